@@ -6,14 +6,16 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 logger = logging.getLogger(__name__)
 from channels.db import database_sync_to_async
 from django.utils import timezone
-from .models import ChatRoom, ChatMessage
+from .models import ChatRoom
+from .presence import get_presence_store, schedule_broadcast
+from .replay import forget, missed_messages, remember
+from .write_behind import get_writer, mention_user_ids, to_coord
 
 # ====== WebSocket Consumer สำหรับระบบแชทแบบ Real-time ======
 
-# ตัวแปร in-memory เก็บสถานะผู้ใช้ที่ออนไลน์อยู่ในแต่ละห้อง
-# โครงสร้าง: { room_id: { channel_name: { 'id': user_id, 'username': ... } } }
-# หมายเหตุ: ข้อมูลนี้จะหายเมื่อ Server รีสตาร์ท เนื่องจากเก็บใน RAM เท่านั้น
-online_users_by_room = {}
+# สถานะผู้ใช้ที่ออนไลน์ของแต่ละห้องเก็บใน presence store (chat/presence.py)
+# — Redis เมื่อรันหลาย Daphne process, หน่วยความจำของ process เมื่อรันตัวเดียว
+# ข้อความที่พลาดระหว่างหลุดการเชื่อมต่อส่งให้ตอน connect จาก ?last_seq= (chat/replay.py)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -24,7 +26,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     หน้าที่หลัก:
     - รับและส่งข้อความแบบ Real-time ระหว่างผู้ใช้ในห้องเดียวกัน
     - จัดการรายชื่อผู้ใช้ที่ออนไลน์ (Online Presence)
-    - บันทึกข้อความลงฐานข้อมูลทุกครั้งที่มีการส่ง
+    - บันทึกข้อความลงฐานข้อมูลทุกครั้งที่มีการส่ง (รวบเป็นชุดกับข้อความอื่นของ process — chat/write_behind.py)
     - รองรับทั้งข้อความตัวอักษร รูปภาพ ไฟล์แนบ และพิกัด GPS
     """
 
@@ -36,6 +38,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         - ดึง room_id จาก URL
         - ปฏิเสธการเชื่อมต่อถ้าผู้ใช้ไม่ได้ Login
         - เข้าร่วม Channel Group ของห้องแชทนั้น
+        - ส่งข้อความที่ client พลาดไป (seq > ?last_seq=) ตามลำดับ
         - เพิ่มชื่อเข้ารายชื่อออนไลน์ และแจ้งทุกคนในห้อง
         """
         # ดึงไอดีห้องจาก URL parameter ที่กำหนดไว้ใน routing.py
@@ -55,14 +58,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # ยืนยันการเชื่อมต่อ (ถ้าไม่เรียก accept() WebSocket จะถูกปฏิเสธ)
             await self.accept()
 
-            # บันทึกข้อมูลผู้ใช้เข้าสู่รายชื่อออนไลน์ (keyed by channel_name)
-            if self.room_id not in online_users_by_room:
-                online_users_by_room[self.room_id] = {}
+            # ส่งข้อความที่พลาดไป — group_add ทำก่อนแล้ว ข้อความใหม่ระหว่างนี้จึงไม่หาย
+            # (event จาก group รอคิวจน connect() จบ และ chat_message() ข้ามลำดับที่ส่งไปแล้ว)
+            self.replayed_seq = 0
+            await self.replay_missed()
 
-            online_users_by_room[self.room_id][self.channel_name] = {
+            # บันทึกข้อมูลผู้ใช้เข้าสู่รายชื่อออนไลน์ (keyed by channel_name)
+            self.presence_info = {
                 'id': self.scope["user"].id,
                 'username': self.scope["user"].username
             }
+            await get_presence_store().join(self.room_id, self.channel_name, self.presence_info)
 
             # แจ้งให้ทุกคนในห้องทราบว่ามีคนออนไลน์เพิ่มขึ้น
             await self.broadcast_online_users()
@@ -75,8 +81,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         - ออกจาก Channel Group
         """
         # ลบผู้ใช้ออกจากรายชื่อออนไลน์และ Broadcast ให้ทุกคนทราบ
-        if self.room_id in online_users_by_room and self.channel_name in online_users_by_room[self.room_id]:
-            del online_users_by_room[self.room_id][self.channel_name]
+        if getattr(self, 'presence_info', None):
+            await get_presence_store().leave(self.room_id, self.channel_name)
             await self.broadcast_online_users()
 
         # ออกจาก Channel Group ของห้องแชท
@@ -99,8 +105,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         data = json.loads(text_data)
 
         # Heartbeat ping/pong — ตอบกลับทันทีเพื่อยืนยันว่า connection ยังมีชีวิตอยู่
+        # และต่ออายุสถานะออนไลน์ (TTL) ใน presence store
         if data.get('type') == 'ping':
             await self.send(text_data=json.dumps({'type': 'pong'}))
+            await get_presence_store().join(self.room_id, self.channel_name, self.presence_info)
             return
 
         message_text = data.get('message', '').strip()
@@ -128,23 +136,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # ประมวลผลเฉพาะเมื่อมีเนื้อหาที่ส่งได้ (ข้อความ, ไฟล์, หรือพิกัด)
         if message_text or image_url or file_url or (latitude and longitude):
             user = self.scope["user"]
-            # บันทึกข้อความลง Database และรับ ID กลับมาเพื่อใช้ deduplication
-            msg_id = await self.save_message(
-                user, self.room_id, message_text, is_stt,
-                latitude, longitude, location_name,
-                gps_check_type=gps_check_type or '',
-                customer_rating=customer_rating,
-                customer_name=customer_name,
-                customer_phone=customer_phone,
-                reply_to_id=reply_to_id,
-                reply_preview=reply_preview,
-            )
-            # บันทึก GPS log สำหรับรายงานช่างภาคสนาม
+            # บันทึกข้อความ + GPS log + ผลประเมิน (CHECK_OUT) ในชุดเดียว แล้วรับ ID / ลำดับในห้องกลับมา
+            # เพื่อใช้ deduplication และ replay — ข้อความที่เข้ามาพร้อมกันใช้ DB hop เดียวกัน
+            gps = None
             if latitude and longitude and gps_check_type:
-                gps_log_id = await self.save_gps_log(user, latitude, longitude, location_name, gps_check_type, gps_notes)
+                # บันทึก GPS log สำหรับรายงานช่างภาคสนาม
+                gps = {
+                    'latitude': latitude, 'longitude': longitude, 'location_name': location_name,
+                    'check_type': gps_check_type, 'notes': gps_notes,
+                }
+            satisfaction = None
+            if gps and gps_check_type == 'CHECK_OUT' and customer_rating:
                 # บันทึกประเมินความพอใจลูกค้าเมื่อ CHECK_OUT
-                if gps_check_type == 'CHECK_OUT' and customer_rating and gps_log_id:
-                    await self.save_satisfaction(gps_log_id, customer_rating, customer_name, customer_phone)
+                satisfaction = {
+                    'rating': customer_rating,
+                    'customer_name': customer_name or '',
+                    'customer_phone': customer_phone or '',
+                }
+            try:
+                msg_id, msg_seq = await get_writer().submit({
+                    'room_id': int(self.room_id),
+                    'user_id': user.id,
+                    'content': message_text,
+                    'is_speech_to_text': is_stt,
+                    'latitude': to_coord(latitude),
+                    'longitude': to_coord(longitude),
+                    'location_name': location_name,
+                    'gps_check_type': gps_check_type or '',
+                    'customer_rating': customer_rating or '',
+                    'customer_name': customer_name or '',
+                    'customer_phone': customer_phone or '',
+                    'reply_to_id': reply_to_id if reply_to_id else None,
+                    'reply_preview': reply_preview or '',
+                }, gps=gps, satisfaction=satisfaction)
+            except Exception as e:
+                logger.error("save chat message failed in room %s: %s", self.room_id, e)
+                return
 
             # แยก @mention จากข้อความ (lowercase) เช่น ['all', 'somchai']
             raw_mentions = re.findall(r'@(\w+)', message_text, re.IGNORECASE)
@@ -156,6 +183,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 {
                     'type': 'chat_message',   # ชี้ไปที่ method chat_message() ด้านล่าง
                     'id': msg_id,             # ใช้ deduplication ฝั่ง JS เมื่อ fetch ซ้อนทับ WS
+                    'seq': msg_seq,           # ลำดับในห้อง — client ส่งกลับมาเป็น ?last_seq= ตอน reconnect
                     'message': message_text,
                     'username': user.username,
                     'user_id': user.id,
@@ -181,7 +209,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             # ส่ง notification ไปยังผู้ใช้ที่ถูก @mention
             if mentions:
-                room_name = await self.get_room_name(self.room_id)
+                room_name = await self.get_room_name()
                 preview = (message_text[:70] + '…') if len(message_text) > 70 else message_text
                 notif = {
                     'type': 'send_notification',
@@ -196,7 +224,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 # ส่งตรงไปยัง user ที่ถูก mention เฉพาะ
                 specific = [m for m in mentions if m != 'all']
                 if specific:
-                    uid_list = await self.get_user_ids_by_usernames(specific)
+                    uid_list = await mention_user_ids(specific)
                     for uid in uid_list:
                         if uid != user.id:
                             await self.channel_layer.group_send(f'user_notif_{uid}', notif)
@@ -209,10 +237,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
         ทำหน้าที่ส่งข้อมูลข้อความกลับไปยัง WebSocket ของ Client แต่ละราย
         เรียกโดยอัตโนมัติเมื่อมีการ group_send ด้วย type='chat_message'
         """
+        # ข้อความที่ส่งไปแล้วตอน replay (มาถึงระหว่าง connect) ไม่ต้องส่งซ้ำ
+        seq = event.get('seq') or 0
+        if seq and seq <= self.replayed_seq:
+            return
+
         # ส่งข้อมูลทั้งหมดกลับไปยัง WebSocket ของ Client ที่ subscribe อยู่
-        await self.send(text_data=json.dumps({
+        payload = {
             'type': 'chat_message',
             'id': event.get('id'),
+            'seq': seq,
             'message': event['message'],
             'username': event['username'],
             'user_id': event['user_id'],
@@ -232,32 +266,52 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'reply_preview': event.get('reply_preview', ''),
             'reply_username': event.get('reply_username', ''),
             'timestamp': event['timestamp']
+        }
+        remember(self.room_id, payload)
+        await self.send(text_data=json.dumps(payload))
+
+    async def message_deleted(self, event):
+        """Handler สำหรับ event 'message_deleted' (message_delete view) — ให้ client เอาข้อความออกจากหน้าจอ"""
+        forget(self.room_id, event['message_id'])
+        await self.send(text_data=json.dumps({
+            'type': 'message_deleted',
+            'message_id': event['message_id'],
         }))
 
+    # ====== ส่งข้อความที่พลาดไปตอนเชื่อมต่อใหม่ (Resume) ======
+
+    async def replay_missed(self):
+        """
+        ส่งข้อความที่ seq มากกว่า ?last_seq= ของ client ตามลำดับ (จาก buffer ของ process ก่อน แล้วค่อย DB)
+        ถ้าไม่ส่ง last_seq มา (โหลดหน้าใหม่ — ข้อความล่าสุด render มากับหน้าแล้ว) ไม่ต้องส่งอะไร
+        ถ้าพลาดไปมากเกินจะส่ง type 'resync' ให้ client โหลดหน้าใหม่แทน
+        """
+        from urllib.parse import parse_qs
+
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            last_seen = int(query.get('last_seq', [''])[0])
+        except ValueError:
+            return
+        if last_seen < 0:
+            return
+
+        payloads, current = await missed_messages(self.room_id, last_seen)
+        self.replayed_seq = current
+        if payloads is None:
+            await self.send(text_data=json.dumps({'type': 'resync', 'last_seq': current}))
+            return
+        for payload in payloads:
+            await self.send(text_data=json.dumps(payload))
+
     # ====== ระบบแสดงผู้ใช้ออนไลน์ (Online Presence System) ======
 
     async def broadcast_online_users(self):
         """
-        Broadcast รายชื่อผู้ใช้ที่ออนไลน์อยู่ในห้องนี้ไปยังทุกคน
-        คัดกรองผู้ใช้ที่ซ้ำกันออกก่อน (กรณี 1 คนเปิดหลายแท็บ/หน้าจอ)
+        นัด Broadcast รายชื่อผู้ใช้ที่ออนไลน์อยู่ในห้องนี้ไปยังทุกคน (debounce — chat/presence.py)
+        การเข้า/ออกหลายครั้งในช่วงสั้นๆ รวมเป็น broadcast เดียว รายชื่อกรองคนซ้ำแล้ว (1 คนเปิดหลายแท็บ)
         """
-        if self.room_id in online_users_by_room:
-            # ใช้ user_id เป็น key เพื่อกรองคนซ้ำออก (deduplication)
-            unique_users = {}
-            for channel, user_info in online_users_by_room[self.room_id].items():
-                unique_users[user_info['id']] = user_info
-            online_list = list(unique_users.values())
-        else:
-            online_list = []
-
-        # ส่ง event ไปยัง Channel Group เพื่อให้ทุกคนอัปเดต Online List
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'online_users_update',   # ชี้ไปที่ method online_users_update()
-                'users': online_list
-            }
-        )
+        schedule_broadcast(self.room_id, self.room_group_name)
 
     async def online_users_update(self, event):
         """
@@ -271,92 +325,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     # ====== ฟังก์ชันช่วยสำหรับฐานข้อมูล (Database Helper) ======
 
-    @database_sync_to_async
-    def save_message(self, user, room_id, content, is_stt, lat=None, lon=None, loc_name='',
-                     gps_check_type='', customer_rating='', customer_name='', customer_phone='',
-                     reply_to_id=None, reply_preview=''):
-        """
-        บันทึกข้อความลงฐานข้อมูลแบบ Synchronous และคืน ID ของข้อความที่บันทึก
-        ID ที่ได้จะถูกส่งไปยัง client ผ่าน WebSocket เพื่อใช้ deduplication กับ fetch
-        """
-        from decimal import Decimal, ROUND_HALF_UP
-        room = ChatRoom.objects.get(id=room_id)
-        def to_dec(v):
-            if v is None: return None
-            return Decimal(str(v)).quantize(Decimal('0.000000001'), rounding=ROUND_HALF_UP)
-        msg = ChatMessage.objects.create(
-            room=room,
-            user=user,
-            content=content,
-            is_speech_to_text=is_stt,
-            latitude=to_dec(lat),
-            longitude=to_dec(lon),
-            location_name=loc_name,
-            gps_check_type=gps_check_type or '',
-            customer_rating=customer_rating or '',
-            customer_name=customer_name or '',
-            customer_phone=customer_phone or '',
-            reply_to_id=reply_to_id if reply_to_id else None,
-            reply_preview=reply_preview or '',
-        )
-        return msg.id
-
-    @database_sync_to_async
-    def save_gps_log(self, user, lat, lon, loc_name, check_type, notes=''):
-        """บันทึก GPS log สำหรับรายงานช่างภาคสนาม"""
-        try:
-            from pms.models import TechnicianGPSLog
-            from decimal import Decimal, ROUND_HALF_UP
-
-            # ตรวจสอบพิกัดอยู่ในประเทศไทย (bounding box กว้างๆ รวม EEZ)
-            # ไทย: lat 5.5–20.5, lon 97.5–105.7
-            lat_f = float(lat)
-            lon_f = float(lon)
-            if not (5.0 <= lat_f <= 21.0 and 97.0 <= lon_f <= 106.0):
-                logger.warning(
-                    "save_gps_log blocked: coords outside Thailand (%.6f, %.6f) user=%s",
-                    lat_f, lon_f, user
-                )
-                return
-
-            # Truncate to 9 decimal places to satisfy DecimalField(max_digits=12, decimal_places=9)
-            lat_d = Decimal(str(lat)).quantize(Decimal('0.000000001'), rounding=ROUND_HALF_UP)
-            lon_d = Decimal(str(lon)).quantize(Decimal('0.000000001'), rounding=ROUND_HALF_UP)
-            log = TechnicianGPSLog.objects.create(
-                user=user,
-                latitude=lat_d,
-                longitude=lon_d,
-                location_name=loc_name or '',
-                check_type=check_type,
-                notes=notes or '',
-            )
-            return log.id
-        except Exception as e:
-            logger.error("save_gps_log failed for user %s: %s", user, e)
-
-    @database_sync_to_async
-    def save_satisfaction(self, gps_log_id, rating, customer_name='', customer_phone=''):
-        """บันทึกผลประเมินความพอใจลูกค้าหลัง Check-out"""
-        try:
-            from pms.models import CustomerSatisfaction
-            CustomerSatisfaction.objects.create(
-                gps_log_id=gps_log_id,
-                rating=rating,
-                customer_name=customer_name or '',
-                customer_phone=customer_phone or '',
-            )
-        except Exception as e:
-            logger.error("save_satisfaction failed for gps_log %s: %s", gps_log_id, e)
-
-    @database_sync_to_async
-    def get_room_name(self, room_id):
-        return ChatRoom.objects.get(id=room_id).name
-
-    @database_sync_to_async
-    def get_user_ids_by_usernames(self, usernames):
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        return list(User.objects.filter(username__in=usernames, is_active=True).values_list('id', flat=True))
+    async def get_room_name(self):
+        """ชื่อห้อง (ใช้ในแจ้งเตือน @mention) — query ครั้งเดียวต่อ connection"""
+        if not hasattr(self, 'room_name'):
+            self.room_name = await database_sync_to_async(
+                lambda: ChatRoom.objects.values_list('name', flat=True).get(id=self.room_id)
+            )()
+        return self.room_name
 
 
 # ====== Notification Consumer — รับแจ้งเตือน @mention แบบ Real-time ======
@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:50
+
+from django.db import migrations, models
+
+
+def number_existing_messages(apps, schema_editor):
+    # ให้ลำดับข้อความเดิมของแต่ละห้องตามเวลาส่ง (1, 2, 3, ...) และตั้ง last_seq ของห้อง
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    for room_id in ChatRoom.objects.values_list('id', flat=True):
+        ids = list(ChatMessage.objects.filter(room_id=room_id).order_by('timestamp', 'id').values_list('id', flat=True))
+        ChatMessage.objects.bulk_update(
+            [ChatMessage(id=msg_id, seq=seq) for seq, msg_id in enumerate(ids, start=1)],
+            ['seq'], batch_size=1000,
+        )
+        ChatRoom.objects.filter(id=room_id).update(last_seq=len(ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_alter_chatroom_app_category'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='ลำดับในห้อง'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='ลำดับข้อความล่าสุด'),
+        ),
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop),
+    ]
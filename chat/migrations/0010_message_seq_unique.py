@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:51
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_seq'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='chatmessage',
+            unique_together={('room', 'seq')},
+        ),
+    ]
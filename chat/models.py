@@ -50,6 +50,8 @@ class ChatRoom(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # สถานะการเปิดใช้งาน: False = ซ่อนจากรายการ
     is_active = models.BooleanField(default=True, verbose_name="เปิดใช้งาน")
+    # ลำดับข้อความล่าสุดของห้อง (ChatMessage.seq) — เพิ่มขึ้นทีละ 1 เสมอ ใช้ replay ข้อความที่พลาดตอน reconnect
+    last_seq = models.PositiveBigIntegerField(default=0, editable=False, verbose_name="ลำดับข้อความล่าสุด")
 
     class Meta:
         verbose_name = "ห้องแชท"
@@ -89,6 +91,8 @@ class ChatMessage(models.Model):
 
     # วันเวลาที่ส่งข้อความ (กำหนดอัตโนมัติ ไม่สามารถแก้ไขได้)
     timestamp = models.DateTimeField(auto_now_add=True, verbose_name="เวลาส่ง")
+    # ลำดับข้อความภายในห้อง (1, 2, 3, ... ไม่ซ้ำ ไม่ย้อน) — client ส่งลำดับล่าสุดที่เห็นตอนต่อ WebSocket (chat/replay.py)
+    seq = models.PositiveBigIntegerField(default=0, editable=False, verbose_name="ลำดับในห้อง")
     # ระบุว่าข้อความนี้มาจาก Speech-to-Text หรือไม่ (แสดงไอคอนไมโครโฟนใน UI)
     is_speech_to_text = models.BooleanField(default=False, verbose_name="ส่งด้วยเสียง")
     # ระบุว่า content เป็น HTML (render ด้วย |safe) — ใช้สำหรับข้อความ system เช่น คิวงาน PMS
@@ -112,10 +116,22 @@ class ChatMessage(models.Model):
         verbose_name_plural = "ข้อความแชท"
         # เรียงข้อความจากเก่าไปใหม่ตามเวลา
         ordering = ['timestamp']
+        unique_together = ('room', 'seq')
 
     def __str__(self):
         return f"{self.user.username}: {self.content[:30]}..."
 
+    def save(self, *args, **kwargs):
+        # ข้อความใหม่: จองลำดับถัดไปของห้อง — UPDATE ล็อกแถวห้องจน commit ข้อความพร้อมกันจึงไม่ได้ลำดับซ้ำ
+        if self._state.adding and not self.seq:
+            from django.db import transaction
+            with transaction.atomic():
+                ChatRoom.objects.filter(pk=self.room_id).update(last_seq=models.F('last_seq') + 1)
+                self.seq = ChatRoom.objects.filter(pk=self.room_id).values_list('last_seq', flat=True).get()
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+
 
 # ====== ระบบทำความสะอาดไฟล์อัตโนมัติ (Auto File Cleanup) ======
 
@@ -0,0 +1,152 @@
+# ====== presence.py — ทะเบียนผู้ใช้ออนไลน์ของห้องแชท (ใช้ร่วมกันได้หลาย Daphne process) ======
+# เดิม ChatConsumer เก็บรายชื่อออนไลน์ใน dict ระดับโมดูล (online_users_by_room) — แต่ละ process เห็นแค่ผู้ใช้
+# ที่ต่อเข้ามาที่ตัวเอง จึงรันได้ process เดียว และรายชื่อค้างถ้า process ตายโดยไม่ได้เรียก disconnect
+#
+# - แต่ละ connection (channel_name) มีอายุ TTL วินาที — join ซ้ำทุกครั้งที่ client ส่ง ping (ทุก 15 วินาที) เพื่อต่ออายุ
+#   connection ที่ไม่ ping เกิน TTL ถือว่าหลุด ไม่ต้องพึ่ง disconnect (เช่น process ตาย)
+# - RedisPresenceStore: sorted set ต่อห้อง (score = เวลาหมดอายุ) + hash ข้อมูลผู้ใช้ — ใช้เมื่อมีหลาย process
+# - MemoryPresenceStore: เก็บใน process เดียว (ค่าเริ่มต้นตอนพัฒนา / ใช้แทน Redis ใน test โดยส่ง clock เข้ามาเองได้)
+# - get_presence_store: เลือก backend ตาม settings.CHAT_PRESENCE_BACKEND (สร้างครั้งเดียวต่อ process)
+
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _unique_users(infos):
+    """รายชื่อผู้ใช้ไม่ซ้ำ (1 คนเปิดหลายแท็บ/หน้าจอ = 1 รายการ)"""
+    unique = {}
+    for info in infos:
+        unique[info['id']] = info
+    return list(unique.values())
+
+
+class MemoryPresenceStore:
+    """ทะเบียนออนไลน์ใน process เดียว — { room_id: { channel_name: (หมดอายุ, ข้อมูลผู้ใช้) } }"""
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._rooms = {}
+
+    async def join(self, room_id, channel_name, user_info):
+        """เข้าห้อง / ต่ออายุ (heartbeat)"""
+        self._rooms.setdefault(str(room_id), {})[channel_name] = (self.clock() + self.ttl, user_info)
+
+    async def leave(self, room_id, channel_name):
+        room = self._rooms.get(str(room_id))
+        if room is not None:
+            room.pop(channel_name, None)
+            if not room:
+                self._rooms.pop(str(room_id), None)
+
+    async def members(self, room_id):
+        room = self._rooms.get(str(room_id), {})
+        now = self.clock()
+        for channel_name in [c for c, (expires, _) in room.items() if expires <= now]:
+            del room[channel_name]
+        return _unique_users(info for _, info in room.values())
+
+
+class RedisPresenceStore:
+    """ทะเบียนออนไลน์ใน Redis — ทุก Daphne process เห็นรายชื่อเดียวกัน"""
+
+    def __init__(self, url, ttl, prefix='chat:presence'):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self.redis = redis.from_url(url, decode_responses=True)
+
+    def _keys(self, room_id):
+        return f'{self.prefix}:{room_id}', f'{self.prefix}:{room_id}:info'
+
+    async def join(self, room_id, channel_name, user_info):
+        """เข้าห้อง / ต่ออายุ (heartbeat)"""
+        expiry_key, info_key = self._keys(room_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(expiry_key, {channel_name: time.time() + self.ttl})
+            pipe.hset(info_key, channel_name, json.dumps(user_info))
+            # ห้องที่ไม่มีใครต่ออายุเลยจะหายไปเอง
+            pipe.expire(expiry_key, self.ttl * 2)
+            pipe.expire(info_key, self.ttl * 2)
+            await pipe.execute()
+
+    async def leave(self, room_id, channel_name):
+        expiry_key, info_key = self._keys(room_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(expiry_key, channel_name)
+            pipe.hdel(info_key, channel_name)
+            await pipe.execute()
+
+    async def members(self, room_id):
+        expiry_key, info_key = self._keys(room_id)
+        now = time.time()
+        expired = await self.redis.zrangebyscore(expiry_key, '-inf', now)
+        if expired:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zremrangebyscore(expiry_key, '-inf', now)
+                pipe.hdel(info_key, *expired)
+                await pipe.execute()
+        channels = await self.redis.zrange(expiry_key, 0, -1)
+        if not channels:
+            return []
+        infos = await self.redis.hmget(info_key, channels)
+        return _unique_users(json.loads(info) for info in infos if info)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_presence_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                ttl = getattr(settings, 'CHAT_PRESENCE_TTL', 45)
+                if getattr(settings, 'CHAT_PRESENCE_BACKEND', 'memory') == 'redis':
+                    _store = RedisPresenceStore(settings.REDIS_URL, ttl)
+                else:
+                    _store = MemoryPresenceStore(ttl)
+    return _store
+
+
+# ====== Debounce การ broadcast รายชื่อออนไลน์ ======
+# เดิม join/leave ทุกครั้ง broadcast รายชื่อทั้งห้องทันที — ห้อง 50 คน reconnect พร้อมกัน = 50 broadcast × 50 ผู้รับ
+# ตอนนี้แต่ละ process รวบการเปลี่ยนแปลงในช่วง CHAT_PRESENCE_DEBOUNCE วินาทีเป็น broadcast เดียวต่อห้อง
+# (หลาย process → ไม่เกินหนึ่งครั้งต่อ process ต่อช่วง) และอ่านรายชื่อจาก store ตอนส่งจริง จึงได้รายชื่อล่าสุดเสมอ
+
+_pending_broadcasts = {}
+
+
+def schedule_broadcast(room_id, group_name):
+    """นัด broadcast รายชื่อออนไลน์ของห้อง (ถ้านัดไว้แล้วในช่วงนี้ ไม่ต้องทำอะไร) — เรียกจากใน event loop"""
+    if room_id in _pending_broadcasts:
+        return
+    _pending_broadcasts[room_id] = asyncio.get_running_loop().create_task(
+        _broadcast_later(room_id, group_name)
+    )
+
+
+async def _broadcast_later(room_id, group_name):
+    from channels.layers import get_channel_layer
+
+    try:
+        await asyncio.sleep(getattr(settings, 'CHAT_PRESENCE_DEBOUNCE', 0.5))
+    finally:
+        _pending_broadcasts.pop(room_id, None)
+    try:
+        users = await get_presence_store().members(room_id)
+        await get_channel_layer().group_send(group_name, {
+            'type': 'online_users_update',   # ชี้ไปที่ ChatConsumer.online_users_update()
+            'users': users,
+        })
+    except Exception as e:
+        logger.error("presence broadcast failed for room %s: %s", room_id, e)
@@ -0,0 +1,106 @@
+# ====== replay.py — ส่งข้อความที่พลาดไปให้ client ตอน WebSocket reconnect (แทนการ poll fetch_new_messages) ======
+# เดิมหน้าห้องแชทเรียก fetch_new_messages ทุกครั้งที่ WS ต่อใหม่ / กลับมาที่แท็บ — มือถือสลับแอปบ่อย = query ประวัติซ้ำๆ
+# และเทียบด้วย timestamp ของเครื่อง client ซึ่งพลาดข้อความที่บันทึกในวินาทีเดียวกันได้
+#
+# ตอนนี้ทุกข้อความมี ChatMessage.seq เรียงต่อเนื่องในห้อง (1, 2, 3, ...) — client ส่ง ?last_seq=<ลำดับล่าสุดที่เห็น>
+# มากับ URL ของ WebSocket แล้ว ChatConsumer ส่งข้อความที่ลำดับมากกว่านั้นให้หลัง accept:
+#   - ข้อความล่าสุดของแต่ละห้องเก็บไว้ใน ring buffer ของ process (REPLAY_BUFFER_SIZE ข้อความ) — reconnect สั้นๆ ไม่แตะ DB
+#   - ส่วนที่ไม่อยู่ใน buffer (เก่ากว่า / process นี้ไม่ได้รับ) ดึงจาก DB ด้วย seq ในครั้งเดียว
+#   - ถ้าพลาดไปเกิน REPLAY_LIMIT ข้อความ ให้ client โหลดหน้าใหม่ (type 'resync') แทนการส่งทีละข้อความ
+
+from django.conf import settings
+from django.utils import timezone
+
+REPLAY_BUFFER_SIZE = getattr(settings, 'CHAT_REPLAY_BUFFER_SIZE', 200)
+REPLAY_LIMIT = getattr(settings, 'CHAT_REPLAY_LIMIT', 500)
+
+# { room_id: { seq: payload } } — เข้าถึงจาก event loop เท่านั้น
+_buffers = {}
+
+
+def message_payload(msg):
+    """ข้อมูลข้อความในรูปเดียวกับ event 'chat_message' ที่ส่งทาง WebSocket (ใช้ร่วมกับ fetch_new_messages)"""
+    return {
+        'type': 'chat_message',
+        'id': msg.id,
+        'seq': msg.seq,
+        'user_id': msg.user_id,
+        'username': msg.user.username,
+        'message': msg.content,
+        'is_html': msg.is_html,
+        'timestamp': timezone.localtime(msg.timestamp).strftime('%H:%M'),
+        'timestamp_iso': msg.timestamp.isoformat(),
+        'image_url': msg.image.url if msg.image else None,
+        'file_url': msg.file.url if msg.file else None,
+        'latitude': float(msg.latitude) if msg.latitude else None,
+        'longitude': float(msg.longitude) if msg.longitude else None,
+        'location_name': msg.location_name or '',
+        'is_stt': msg.is_speech_to_text,
+        'gps_check_type': msg.gps_check_type or '',
+        'customer_rating': msg.customer_rating or '',
+        'customer_name': msg.customer_name or '',
+        'customer_phone': msg.customer_phone or '',
+        'reply_to_id': msg.reply_to_id,
+        'reply_preview': msg.reply_preview or '',
+        'reply_username': msg.reply_to.user.username if msg.reply_to_id and msg.reply_to else '',
+    }
+
+
+def remember(room_id, payload):
+    """เก็บข้อความที่เพิ่ง broadcast ไว้ใน buffer ของห้อง (ข้อความเดียวกันจากหลาย consumer เก็บครั้งเดียว)"""
+    seq = payload.get('seq')
+    if not seq:
+        return
+    buffer = _buffers.setdefault(str(room_id), {})
+    buffer[seq] = payload
+    if len(buffer) > REPLAY_BUFFER_SIZE:
+        for old in sorted(buffer)[:len(buffer) - REPLAY_BUFFER_SIZE]:
+            del buffer[old]
+
+
+def forget(room_id, message_id):
+    """เอาข้อความที่ถูกลบออกจาก buffer"""
+    buffer = _buffers.get(str(room_id), {})
+    for seq in [s for s, p in buffer.items() if p.get('id') == message_id]:
+        del buffer[seq]
+
+
+def last_seq(room_id):
+    from .models import ChatRoom
+
+    return ChatRoom.objects.filter(pk=room_id).values_list('last_seq', flat=True).first() or 0
+
+
+def load_messages(room_id, after, upto):
+    """ข้อความที่ after < seq <= upto จาก DB — Returns: { seq: payload }"""
+    from .models import ChatMessage
+
+    msgs = (
+        ChatMessage.objects.filter(room_id=room_id, seq__gt=after, seq__lte=upto)
+        .select_related('user', 'reply_to__user').order_by('seq')
+    )
+    return {msg.seq: message_payload(msg) for msg in msgs}
+
+
+async def missed_messages(room_id, after):
+    """
+    ข้อความของห้องที่ seq > after เรียงตามลำดับ
+    Returns: (รายการ payload, seq ล่าสุดของห้อง) — รายการเป็น None ถ้าพลาดเกิน REPLAY_LIMIT (client ควรโหลดหน้าใหม่)
+    """
+    from channels.db import database_sync_to_async
+
+    current = await database_sync_to_async(last_seq)(room_id)
+    if current <= after:
+        return [], current
+    if current - after > REPLAY_LIMIT:
+        return None, current
+
+    buffer = _buffers.get(str(room_id), {})
+    found = {seq: buffer[seq] for seq in range(after + 1, current + 1) if seq in buffer}
+    missing = [seq for seq in range(after + 1, current + 1) if seq not in found]
+    if missing:
+        # ข้อความที่ถูกลบไปแล้วจะไม่มีใน DB — ช่องว่างของ seq จึงเป็นเรื่องปกติ
+        loaded = await database_sync_to_async(load_messages)(room_id, missing[0] - 1, missing[-1])
+        for seq, payload in loaded.items():
+            found.setdefault(seq, payload)
+    return [found[seq] for seq in sorted(found)], current
@@ -1,3 +1,195 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from pms import gps_rollup
+from pms.models import CustomerSatisfaction, TechnicianDaySummary, TechnicianGPSLog, TechnicianTrackingState
+
+from .models import ChatMessage, ChatRoom
+from .presence import MemoryPresenceStore, schedule_broadcast
+from .write_behind import _Entry, _gps_logs_created, _write_entries, write_batch
+
+_BANGKOK = {'latitude': 13.7563, 'longitude': 100.5018, 'location_name': 'กรุงเทพ'}
+
+
+class WriteBehindTest(TestCase):
+    """บันทึกข้อความเป็นชุด: seq ต่อเนื่องต่อห้อง, รายการที่เสียไม่ทำให้ทั้งชุดเสีย, GPS log ทำงานเหมือน save ทีละแถว"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('tech', 'tech@example.com', 'pw')
+        cls.room_a = ChatRoom.objects.create(name='ห้อง A')
+        cls.room_b = ChatRoom.objects.create(name='ห้อง B')
+
+    def _entry(self, room_id, content='ข้อความ', gps=None, satisfaction=None):
+        return _Entry({'room_id': room_id, 'user_id': self.user.id, 'content': content}, gps, satisfaction, None)
+
+    def test_batch_reserves_seq_per_room(self):
+        ChatMessage.objects.create(room=self.room_a, user=self.user, content='เก่า')
+        entries = [self._entry(room.pk, str(i)) for i, room in enumerate(
+            [self.room_a, self.room_b, self.room_a, self.room_b, self.room_a])]
+        results = write_batch(entries, [])
+
+        self.assertEqual([seq for _, seq in results], [2, 1, 3, 2, 4])
+        self.assertEqual(
+            list(ChatMessage.objects.filter(pk__in=[pk for pk, _ in results]).order_by('pk').values_list('content', 'seq')),
+            [('0', 2), ('1', 1), ('2', 3), ('3', 2), ('4', 4)],
+        )
+        self.assertEqual(
+            dict(ChatRoom.objects.filter(pk__in=[self.room_a.pk, self.room_b.pk]).values_list('pk', 'last_seq')),
+            {self.room_a.pk: 4, self.room_b.pk: 2},
+        )
+
+    def test_failed_batch_falls_back_one_by_one(self):
+        entries = [self._entry(self.room_a.pk, 'ก่อน'), self._entry(self.room_a.pk + 1000), self._entry(self.room_a.pk, 'หลัง')]
+        with self.assertLogs('chat.write_behind', 'WARNING'):
+            results, logs = _write_entries(entries)
+
+        self.assertIsInstance(results[1], ChatRoom.DoesNotExist)
+        # ชุดแรกที่พลาดถูก rollback ทั้งชุด — seq ของรายการที่บันทึกได้ต้องไม่มีช่องโหว่
+        self.assertEqual([results[0][1], results[2][1]], [1, 2])
+        self.assertEqual(list(ChatMessage.objects.values_list('content', flat=True).order_by('seq')), ['ก่อน', 'หลัง'])
+        self.assertEqual(logs, [])
+
+    def test_gps_and_satisfaction_rows(self):
+        entries = [
+            self._entry(self.room_a.pk, gps=dict(_BANGKOK, check_type='CHECK_OUT'),
+                        satisfaction={'rating': 'SATISFIED', 'customer_name': 'ลูกค้า', 'customer_phone': ''}),
+            self._entry(self.room_a.pk, gps={'latitude': 35.68, 'longitude': 139.76, 'check_type': 'CHECK_IN'}),
+            self._entry(self.room_a.pk),
+        ]
+        created = []
+        with self.assertLogs('chat.write_behind', 'WARNING'):  # พิกัดนอกประเทศไทยถูกข้าม
+            write_batch(entries, created)
+
+        self.assertEqual(len(created), 1)
+        log = TechnicianGPSLog.objects.get()
+        self.assertEqual((log.pk, log.user_id, log.check_type), (created[0].pk, self.user.id, 'CHECK_OUT'))
+        self.assertEqual(CustomerSatisfaction.objects.get().gps_log_id, log.pk)
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+    def test_bad_gps_keeps_message(self):
+        entries = [
+            self._entry(self.room_a.pk, 'พิกัดเสีย', gps={'latitude': 'abc', 'longitude': '100.5', 'check_type': 'ON_SITE'}),
+            self._entry(self.room_a.pk, 'ปกติ', gps=dict(_BANGKOK, check_type='ON_SITE')),
+        ]
+        created = []
+        with self.assertLogs('chat.write_behind', 'ERROR') as logs:
+            results = write_batch(entries, created)
+
+        self.assertIn('save_gps_log failed', logs.output[0])
+        self.assertEqual([seq for _, seq in results], [1, 2])
+        self.assertEqual(ChatMessage.objects.count(), 2)
+        self.assertEqual([log.pk for log in created], list(TechnicianGPSLog.objects.values_list('pk', flat=True)))
+
+    def test_failed_gps_batch_retries_one_by_one(self):
+        entries = [
+            self._entry(self.room_a.pk, gps=dict(_BANGKOK, check_type='CHECK_OUT'),
+                        satisfaction={'rating': 'SATISFIED', 'customer_name': '', 'customer_phone': ''}),
+            self._entry(self.room_a.pk, gps=dict(_BANGKOK, check_type='CHECK_IN')),
+        ]
+        created = []
+        with mock.patch.object(CustomerSatisfaction.objects, 'bulk_create', side_effect=RuntimeError('boom')), \
+                self.assertLogs('chat.write_behind', 'WARNING'):
+            write_batch(entries, created)
+
+        self.assertEqual(ChatMessage.objects.count(), 2)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(TechnicianGPSLog.objects.count(), 2)
+        self.assertEqual(CustomerSatisfaction.objects.get().gps_log_id, created[0].pk)
+
+    def test_gps_signals_dispatched_once_per_day(self):
+        created = []
+        write_batch([
+            self._entry(self.room_a.pk, gps=dict(_BANGKOK, check_type=check_type))
+            for check_type in ('GO_WORK', 'ON_SITE', 'CHECK_OUT')
+        ], created)
+
+        with mock.patch('stocks.telegram_utils.send_telegram_message') as send, \
+                mock.patch.object(gps_rollup, 'refresh_days', wraps=gps_rollup.refresh_days) as refresh, \
+                self.captureOnCommitCallbacks(execute=True):
+            _gps_logs_created(created)
+
+        self.assertTrue(TechnicianTrackingState.objects.get(user=self.user).force_track)
+        send.assert_not_called()  # ไม่มี telegram_profile — handler เดิมข้ามไปเอง
+        refresh.assert_called_once()
+        summary = TechnicianDaySummary.objects.get(user=self.user)
+        self.assertEqual((summary.log_count, summary.go_work_count, summary.work_sessions), (3, 1, 1))
+
+    def test_failing_gps_handler_does_not_stop_batch(self):
+        created = []
+        write_batch([self._entry(self.room_a.pk, gps=dict(_BANGKOK, check_type='GO_WORK'))], created)
+        write_batch([self._entry(self.room_b.pk, gps=dict(_BANGKOK, check_type='ON_SITE'))], created)
+
+        with mock.patch('pms.signals._set_force_track', side_effect=RuntimeError('boom')), \
+                self.assertLogs('chat.write_behind', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            _gps_logs_created(created)
+        self.assertEqual(TechnicianDaySummary.objects.get(user=self.user).log_count, 2)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PresenceTest(SimpleTestCase):
+    """รายชื่อออนไลน์: หมดอายุตาม TTL, หลายแท็บนับครั้งเดียว, broadcast รวบเป็นครั้งเดียวต่อช่วง"""
+
+    def setUp(self):
+        self.clock = _Clock()
+        self.store = MemoryPresenceStore(ttl=45, clock=self.clock)
+        self.alice = {'id': 1, 'username': 'alice'}
+        self.bob = {'id': 2, 'username': 'bob'}
+
+    async def test_ttl_expiry_marks_user_offline(self):
+        await self.store.join(7, 'tab-a', self.alice)
+        self.clock.now += 30
+        await self.store.join(7, 'tab-b', self.bob)
+        self.clock.now += 20  # alice ไม่ ping เกิน TTL, bob ยังไม่ครบ
+        self.assertEqual(await self.store.members(7), [self.bob])
+        await self.store.join(7, 'tab-b', self.bob)  # heartbeat ต่ออายุ
+        self.clock.now += 40
+        self.assertEqual(await self.store.members(7), [self.bob])
+        self.clock.now += 10
+        self.assertEqual(await self.store.members(7), [])
+
+    async def test_tabs_of_one_user_count_once(self):
+        for channel in ('tab-1', 'tab-2', 'phone'):
+            await self.store.join(7, channel, self.alice)
+        await self.store.join(7, 'tab-3', self.bob)
+        self.assertEqual(sorted(u['id'] for u in await self.store.members(7)), [1, 2])
+
+    async def test_last_tab_leaving_removes_user(self):
+        await self.store.join(7, 'tab-1', self.alice)
+        await self.store.join(7, 'tab-2', self.alice)
+        await self.store.leave(7, 'tab-1')
+        self.assertEqual(await self.store.members(7), [self.alice])
+        await self.store.leave(7, 'tab-2')
+        self.assertEqual(await self.store.members(7), [])
+        self.assertNotIn('7', self.store._rooms)
+
+    @override_settings(CHAT_PRESENCE_DEBOUNCE=0.01)
+    async def test_broadcast_debounced_per_burst(self):
+        layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch('chat.presence.get_presence_store', return_value=self.store), \
+                mock.patch('channels.layers.get_channel_layer', return_value=layer):
+            for i, user in enumerate((self.alice, self.bob, self.alice)):
+                await self.store.join(8, f'tab-{i}', user)
+                schedule_broadcast(8, 'chat_8')
+            await asyncio.sleep(0.05)
+            layer.group_send.assert_awaited_once()
+            group, event = layer.group_send.await_args.args
+            self.assertEqual((group, event['type']), ('chat_8', 'online_users_update'))
+            self.assertEqual(sorted(u['id'] for u in event['users']), [1, 2])
+
+            # ช่วงถัดไปต้อง broadcast ใหม่ได้ (รายชื่อล่าสุดตอนส่งจริง)
+            await self.store.leave(8, 'tab-1')
+            schedule_broadcast(8, 'chat_8')
+            await asyncio.sleep(0.05)
+        self.assertEqual(layer.group_send.await_count, 2)
+        self.assertEqual([u['id'] for u in layer.group_send.await_args.args[1]['users']], [1])
@@ -60,6 +60,8 @@ def chat_room(request, room_id):
     chat_messages = list(room.messages.all().order_by('-timestamp')[:50])
     chat_messages.reverse()
     last_msg_ts = chat_messages[-1].timestamp.isoformat() if chat_messages else ''
+    # ลำดับข้อความล่าสุดของห้อง ณ ตอน render — client ส่งกลับมาเป็น ?last_seq= ตอนต่อ WebSocket (chat/replay.py)
+    last_msg_seq = room.last_seq
 
     try:
         user_role = request.user.profile.role
@@ -86,6 +88,7 @@ def chat_room(request, room_id):
         'room': room,
         'chat_messages': chat_messages,
         'last_msg_ts': last_msg_ts,
+        'last_msg_seq': last_msg_seq,
         'is_technician': is_technician,
         'room_members': room_members,
     })
@@ -158,6 +161,8 @@ def upload_file(request, room_id):
             f'chat_{room_id}',
             {
                 'type': 'chat_message',
+                'id': message.id,
+                'seq': message.seq,
                 'message': message.content,
                 'username': request.user.username,
                 'user_id': request.user.id,
@@ -174,16 +179,16 @@ def upload_file(request, room_id):
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
-# ====== View ดึงข้อความใหม่ที่พลาดไป (สำหรับ mobile reconnect / manual refresh) ======
+# ====== View ดึงข้อความใหม่ที่พลาดไป (สำหรับปุ่ม manual refresh) ======
 
 @login_required
 def fetch_new_messages(request, room_id):
     """
-    คืนข้อความที่เกิดขึ้นหลังจาก timestamp ที่ระบุใน ?since=<ISO>
-    ใช้สำหรับ:
-      1. Auto-fetch เมื่อ WebSocket reconnect (ดึงข้อความที่พลาดระหว่างหลุดการเชื่อมต่อ)
-      2. ปุ่ม Refresh ที่ user กดเอง
+    คืนข้อความที่ลำดับมากกว่า ?after_seq=<seq> (หรือหลัง ?since=<ISO> สำหรับหน้าที่เปิดค้างไว้ก่อนมี seq)
+    ใช้สำหรับปุ่ม Refresh ที่ user กดเอง — ข้อความที่พลาดตอน reconnect ส่งมาทาง WebSocket แล้ว (chat/replay.py)
     """
+    from .replay import message_payload
+
     room = get_object_or_404(ChatRoom, pk=room_id)
 
     # ตรวจสอบสิทธิ์ห้องส่วนตัว
@@ -191,45 +196,25 @@ def fetch_new_messages(request, room_id):
         if not room.allowed_users.filter(id=request.user.id).exists():
             return JsonResponse({'error': 'forbidden'}, status=403)
 
+    msgs = room.messages.select_related('user', 'reply_to__user')
+    after_seq = request.GET.get('after_seq', '')
     since_iso = request.GET.get('since', '')
     since_dt = None
-    if since_iso:
+    if since_iso and not after_seq:
         from django.utils.dateparse import parse_datetime
         try:
             since_dt = parse_datetime(since_iso)
         except Exception:
             pass
 
-    if since_dt:
-        msgs = room.messages.filter(timestamp__gt=since_dt).order_by('timestamp').select_related('user', 'reply_to__user')[:100]
+    if after_seq.isdigit():
+        msgs = msgs.filter(seq__gt=int(after_seq)).order_by('seq')[:100]
+    elif since_dt:
+        msgs = msgs.filter(timestamp__gt=since_dt).order_by('seq')[:100]
     else:
-        msgs = room.messages.order_by('timestamp').select_related('user', 'reply_to__user')[:50]
-
-    data = []
-    for msg in msgs:
-        data.append({
-            'id': msg.id,
-            'user_id': msg.user_id,
-            'username': msg.user.username,
-            'message': msg.content,
-            'timestamp': timezone.localtime(msg.timestamp).strftime('%H:%M'),
-            'timestamp_iso': msg.timestamp.isoformat(),
-            'image_url': msg.image.url if msg.image else None,
-            'file_url': msg.file.url if msg.file else None,
-            'latitude': float(msg.latitude) if msg.latitude else None,
-            'longitude': float(msg.longitude) if msg.longitude else None,
-            'location_name': msg.location_name or '',
-            'is_stt': msg.is_speech_to_text,
-            'gps_check_type': msg.gps_check_type or '',
-            'customer_rating': msg.customer_rating or '',
-            'customer_name': msg.customer_name or '',
-            'customer_phone': msg.customer_phone or '',
-            'reply_to_id': msg.reply_to_id,
-            'reply_preview': msg.reply_preview or '',
-            'reply_username': msg.reply_to.user.username if msg.reply_to_id and msg.reply_to else '',
-        })
-
-    return JsonResponse({'messages': data})
+        msgs = msgs.order_by('seq')[:50]
+
+    return JsonResponse({'messages': [message_payload(msg) for msg in msgs]})
 
 
 # ====== Administrative Views (Manage Rooms & Messages) ======
@@ -0,0 +1,291 @@
+# ====== write_behind.py — บันทึกข้อความแชท / GPS log / ผลประเมิน เป็นชุด (micro-batch) ======
+# เดิม ChatConsumer.receive รอ save_message → save_gps_log → save_satisfaction → get_user_ids_by_usernames
+# ทีละ database_sync_to_async — ตอนช่างเช็คเอาท์พร้อมกัน (17:00) ทุกข้อความต่อคิวกันบน thread ของ DB
+# และ broadcast ช้าตามจำนวน hop
+#
+# โมดูลนี้:
+#   - MessageWriter.submit: เข้าคิว แล้วรอให้ชุดปัจจุบันถูกบันทึก (รวบข้อความที่เข้ามาในช่วง CHAT_WRITE_BATCH_DELAY
+#     หรือครบ CHAT_WRITE_BATCH_SIZE) — ทั้งชุดใช้ DB hop เดียว: จองลำดับ seq ของแต่ละห้องครั้งเดียว แล้ว bulk_create
+#     ข้อความ, GPS log และผลประเมินในทรานแซกชันเดียว
+#     ข้อความยังต้องได้ id / seq จริงก่อน broadcast (ใช้ตอบกลับ / ลบ / replay ตอน reconnect — chat/replay.py)
+#   - ถ้าทั้งชุดบันทึกไม่ได้ (เช่น ตอบกลับข้อความที่เพิ่งถูกลบ) จะบันทึกทีละรายการ — รายการที่เสียไม่ทำให้ทั้งชุดเสีย
+#   - GPS log / ผลประเมินอยู่ใน savepoint แยก — GPS ที่เสียแค่ log ไว้ ไม่ทำให้ข้อความแชทหาย (เหมือน consumer เดิม)
+#   - mention_user_ids: แปลง @username → user id จากแผนที่ที่ cache ไว้ใน process (โหลดใหม่ทุก MENTION_MAP_TTL วินาที)
+#     แทนการ query ทุกข้อความที่มี mention
+
+import asyncio
+import logging
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_COORD = Decimal('0.000000001')
+
+
+def to_coord(value):
+    """พิกัดแบบ DecimalField(max_digits=12, decimal_places=9)"""
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(_COORD, rounding=ROUND_HALF_UP)
+
+
+def in_thailand(lat, lon):
+    """ไทย: lat 5.5–20.5, lon 97.5–105.7 (bounding box กว้างๆ รวม EEZ)"""
+    return 5.0 <= float(lat) <= 21.0 and 97.0 <= float(lon) <= 106.0
+
+
+class _Entry:
+    __slots__ = ('message', 'gps', 'satisfaction', 'future')
+
+    def __init__(self, message, gps, satisfaction, future):
+        self.message = message
+        self.gps = gps
+        self.satisfaction = satisfaction
+        self.future = future
+
+
+def _build_gps_log(entry, user_id):
+    from pms.models import TechnicianGPSLog
+
+    gps = entry.gps
+    if not gps:
+        return None
+    if not in_thailand(gps['latitude'], gps['longitude']):
+        logger.warning(
+            "save_gps_log blocked: coords outside Thailand (%.6f, %.6f) user=%s",
+            float(gps['latitude']), float(gps['longitude']), user_id,
+        )
+        return None
+    return TechnicianGPSLog(
+        user_id=user_id,
+        latitude=to_coord(gps['latitude']),
+        longitude=to_coord(gps['longitude']),
+        location_name=gps.get('location_name') or '',
+        check_type=gps['check_type'],
+        notes=gps.get('notes') or '',
+    )
+
+
+def write_batch(entries, created_logs):
+    """
+    บันทึกทั้งชุดในทรานแซกชันเดียว — GPS log ที่สร้างถูกเพิ่มเข้า created_logs
+    Returns: [(message_id, seq), ...] ตามลำดับ entries
+    """
+    from django.db import transaction
+    from django.db.models import F
+
+    from .models import ChatMessage, ChatRoom
+
+    per_room = {}
+    for entry in entries:
+        per_room.setdefault(entry.message['room_id'], []).append(entry)
+
+    with transaction.atomic():
+        # จองลำดับต่อเนื่องของแต่ละห้องครั้งเดียว (UPDATE ล็อกแถวห้องจน commit)
+        messages = {}
+        for room_id, room_entries in per_room.items():
+            updated = ChatRoom.objects.filter(pk=room_id).update(last_seq=F('last_seq') + len(room_entries))
+            if not updated:
+                raise ChatRoom.DoesNotExist(f'ChatRoom {room_id} does not exist')
+            last = ChatRoom.objects.filter(pk=room_id).values_list('last_seq', flat=True).get()
+            first = last - len(room_entries) + 1
+            for offset, entry in enumerate(room_entries):
+                messages[id(entry)] = ChatMessage(seq=first + offset, **entry.message)
+        ChatMessage.objects.bulk_create([messages[id(entry)] for entry in entries])
+
+        logs = _write_gps(entries)
+
+    created_logs.extend(logs)
+    return [(messages[id(entry)].pk, messages[id(entry)].seq) for entry in entries]
+
+
+def _write_gps(entries):
+    """
+    GPS log + ผลประเมินของชุด ใน savepoint แยกจากข้อความ — GPS ที่เสีย (พิกัดแปลงไม่ได้, check_type ผิด)
+    แค่ log ไว้ ข้อความแชทยังถูกบันทึกเหมือน save_gps_log / save_satisfaction เดิม
+    Returns: GPS log ที่สร้างได้
+    """
+    from django.db import transaction
+    from pms.models import CustomerSatisfaction, TechnicianGPSLog
+
+    logs = {}
+    for entry in entries:
+        user_id = entry.message['user_id']
+        try:
+            log = _build_gps_log(entry, user_id)
+        except Exception as e:
+            logger.error("save_gps_log failed for user %s: %s", user_id, e)
+            continue
+        if log is not None:
+            logs[id(entry)] = log
+    if not logs:
+        return []
+
+    try:
+        with transaction.atomic():
+            TechnicianGPSLog.objects.bulk_create(list(logs.values()))
+            CustomerSatisfaction.objects.bulk_create([
+                CustomerSatisfaction(gps_log=logs[id(entry)], **entry.satisfaction)
+                for entry in entries
+                if entry.satisfaction and id(entry) in logs
+            ])
+        return list(logs.values())
+    except Exception as e:
+        logger.warning("gps batch write failed (%s), retrying %d logs one by one", e, len(logs))
+
+    created = []
+    for entry in entries:
+        log = logs.get(id(entry))
+        if log is None:
+            continue
+        log.pk = None
+        try:
+            with transaction.atomic():
+                log.save(force_insert=True)
+        except Exception as e:
+            logger.error("save_gps_log failed for user %s: %s", log.user_id, e)
+            continue
+        created.append(log)
+        if entry.satisfaction:
+            try:
+                with transaction.atomic():
+                    CustomerSatisfaction.objects.create(gps_log=log, **entry.satisfaction)
+            except Exception as e:
+                logger.error("save_satisfaction failed for gps_log %s: %s", log.pk, e)
+    return created
+
+
+def _write_entries(entries):
+    """
+    บันทึกทั้งชุด — ถ้าพลาดให้บันทึกทีละรายการ
+    Returns: ([(message_id, seq) หรือ Exception, ...], GPS log ที่สร้าง)
+    """
+    created_logs = []
+    try:
+        return write_batch(entries, created_logs), created_logs
+    except Exception as e:
+        created_logs.clear()
+        if len(entries) == 1:
+            return [e], created_logs
+        logger.warning("chat batch write failed (%s), retrying %d entries one by one", e, len(entries))
+    results = []
+    for entry in entries:
+        try:
+            results.extend(write_batch([entry], created_logs))
+        except Exception as e:
+            results.append(e)
+    return results, created_logs
+
+
+def _gps_logs_created(logs):
+    """
+    bulk_create ไม่ส่ง post_save — ส่งเองให้ handler ของ GPS log (force track / แจ้ง Telegram) ทำงานเหมือนเดิม
+    เรียกหลังตอบผลให้ consumer แล้ว การแจ้ง Telegram จึงไม่หน่วง broadcast
+    ส่งทั้งชุดในทรานแซกชันเดียว (savepoint ต่อ log) — ตารางสรุป GPS (pms/gps_rollup.py) จึงคำนวณครั้งเดียว
+    ต่อ (ช่าง, วัน) หลัง commit แทนการอ่าน log ทั้งวันใหม่ทุกจุด
+    """
+    from django.db import transaction
+    from django.db.models.signals import post_save
+    from pms.models import TechnicianGPSLog
+
+    with transaction.atomic():
+        for log in logs:
+            try:
+                with transaction.atomic():
+                    post_save.send(sender=TechnicianGPSLog, instance=log, created=True,
+                                   update_fields=None, raw=False, using='default')
+            except Exception as e:
+                logger.error("gps log post_save handlers failed for %s: %s", log.pk, e)
+
+
+class MessageWriter:
+    """คิวบันทึกข้อความของ event loop หนึ่ง (หนึ่ง Daphne process)"""
+
+    def __init__(self, delay=None, batch_size=None):
+        self.delay = getattr(settings, 'CHAT_WRITE_BATCH_DELAY', 0.02) if delay is None else delay
+        self.batch_size = getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 100) if batch_size is None else batch_size
+        self._queue = []
+        self._timer = None
+
+    async def submit(self, message, gps=None, satisfaction=None):
+        """
+        message: ฟิลด์ของ ChatMessage (ต้องมี room_id, user_id)
+        gps: {'latitude', 'longitude', 'location_name', 'check_type', 'notes'} หรือ None
+        satisfaction: {'rating', 'customer_name', 'customer_phone'} (บันทึกเมื่อมี GPS log) หรือ None
+        Returns: (message_id, seq) — raise ถ้าบันทึกข้อความไม่ได้
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(_Entry(message, gps, satisfaction, future))
+        if len(self._queue) >= self.batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.delay, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        entries, self._queue = self._queue, []
+        if entries:
+            asyncio.get_running_loop().create_task(self._flush(entries))
+
+    async def _flush(self, entries):
+        from channels.db import database_sync_to_async
+
+        try:
+            results, logs = await database_sync_to_async(_write_entries)(entries)
+        except Exception as e:
+            results, logs = [e] * len(entries), []
+        for entry, result in zip(entries, results):
+            if entry.future.done():
+                continue
+            if isinstance(result, Exception):
+                entry.future.set_exception(result)
+            else:
+                entry.future.set_result(result)
+        if logs:
+            await database_sync_to_async(_gps_logs_created)(logs)
+
+
+_writers = {}
+
+
+def get_writer():
+    """MessageWriter ของ event loop ปัจจุบัน"""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        for old in [l for l in _writers if l.is_closed()]:
+            del _writers[old]
+        writer = _writers[loop] = MessageWriter()
+    return writer
+
+
+# ====== แผนที่ @username → user id สำหรับ mention ======
+
+MENTION_MAP_TTL = 300  # วินาที — ผู้ใช้ใหม่ถูก mention ได้ภายในไม่เกินช่วงนี้
+
+_mention_map = {}
+_mention_map_loaded = None
+
+
+def _refresh_mention_map():
+    global _mention_map, _mention_map_loaded
+    from django.contrib.auth import get_user_model
+
+    User = get_user_model()
+    _mention_map = dict(User.objects.filter(is_active=True).values_list('username', 'id'))
+    _mention_map_loaded = time.monotonic()
+
+
+async def mention_user_ids(usernames):
+    """user id ของ username ที่ถูก mention — แตะ DB เฉพาะตอนแผนที่หมดอายุ"""
+    from channels.db import database_sync_to_async
+
+    if _mention_map_loaded is None or time.monotonic() - _mention_map_loaded > MENTION_MAP_TTL:
+        await database_sync_to_async(_refresh_mention_map)()
+    return [_mention_map[name] for name in usernames if name in _mention_map]
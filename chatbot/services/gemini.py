@@ -7,12 +7,13 @@ import json
 import os
 from datetime import timedelta  # สำหรับคำนวณช่วงเวลา เช่น 3 วันที่ผ่านมา
 
-import google.genai as genai  # Google GenAI SDK สำหรับเรียกใช้ Gemini API
 from django.conf import settings  # อ่านค่า config จาก Django settings
 from django.db.models import Count, Q  # Q สำหรับ complex query, Count สำหรับนับจำนวน
 from django.utils import timezone  # utility สำหรับจัดการเวลาใน timezone ที่ถูกต้อง
 from google.genai import types  # types สำหรับกำหนด config ของ Gemini
 
+from utils.llm_gateway import generate as llm_generate  # จุดเรียก Gemini กลาง (จำกัดจำนวนเรียกพร้อมกัน + metrics)
+
 # ====== API Key Configuration ======
 # อ่าน Gemini API Key จาก Django settings ก่อน ถ้าไม่มีให้อ่านจาก environment variable
 api_key = getattr(settings, 'GEMINI_API_KEY', os.environ.get('GEMINI_API_KEY'))
@@ -171,7 +172,7 @@ def gemini_chat_sync(user_text, user=None):
     9Com Intelligence Logic using google-genai SDK
 
     ขั้นตอนการทำงาน:
-    1. สร้าง Gemini client ด้วย API key
+    1. เรียก Gemini ผ่าน LLM gateway (ใช้ client ร่วมกันทั้ง process)
     2. กำหนด system instruction ที่บอก AI ว่าเป็นใครและมีความสามารถอะไร
     3. ส่งข้อความผู้ใช้พร้อม tools ไปให้ Gemini ประมวลผล
     4. Gemini อาจเรียก function tools อัตโนมัติเพื่อดึงข้อมูลจากระบบ
@@ -184,9 +185,6 @@ def gemini_chat_sync(user_text, user=None):
     Returns:
         str: คำตอบจาก Gemini AI หรือข้อความ error หากเกิดปัญหา
     """
-    # สร้าง Gemini client instance ด้วย API key ที่กำหนดไว้
-    client = genai.Client(api_key=api_key)
-
     # กำหนด system instruction: บอก AI ว่าเป็น "9Com Intelligence"
     # พร้อมอธิบายประเภทงาน, วิธีตรวจหางานช้า, และวิธีตอบ
     system_instruction = (
@@ -218,17 +216,19 @@ def gemini_chat_sync(user_text, user=None):
         # - system_instruction: คำสั่งบทบาทของ AI
         # - tools: รายการ function ที่ AI เรียกใช้ได้
         # - automatic_function_calling: เปิดให้ AI เรียก function อัตโนมัติโดยไม่ต้องรอ
-        response = client.models.generate_content(
+        # - cache=False: tools ดึงข้อมูลสดจากระบบ คำถามเดิมอาจได้คำตอบต่างกัน
+        return llm_generate(
+            user_text,
+            use_case='chatbot',
             model='gemini-3-flash-preview',
-            contents=user_text,
+            user=user,
             config=types.GenerateContentConfig(
                 system_instruction=system_instruction,
                 tools=all_tools,
                 automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False)
-            )
+            ),
+            cache=False,
         )
-        # คืนค่าข้อความคำตอบจาก Gemini
-        return response.text
     except Exception as e:
         # หากเกิด error ในการเรียก API ให้ส่งข้อความแจ้งผู้ใช้เป็นภาษาไทย
         return f"ขออภัยครับ เกิดข้อผิดพลาด: {str(e)}"
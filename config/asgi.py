@@ -28,12 +28,14 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack  # Middleware สำหรับ authenticate WebSocket connections
 import pms.routing   # URL patterns สำหรับ WebSocket ของแอป PMS
 import chat.routing  # URL patterns สำหรับ WebSocket ของแอป Chat
+import stocks.routing  # URL patterns สำหรับ WebSocket ของแอป Stocks (สถานะงานสแกน)
 
 # ====== รวม WebSocket URL Patterns ======
 # รวมเส้นทาง WebSocket จากทุกแอปเข้าด้วยกัน
 combined_websocket_urls = (
     pms.routing.websocket_urlpatterns +   # WebSocket routes ของ PMS (เช่น real-time notifications)
-    chat.routing.websocket_urlpatterns    # WebSocket routes ของ Chat (real-time messaging)
+    chat.routing.websocket_urlpatterns +  # WebSocket routes ของ Chat (real-time messaging)
+    stocks.routing.websocket_urlpatterns  # WebSocket routes ของ Stocks (progress ของ scanner)
 )
 
 # ====== ASGI Application ======
@@ -250,15 +250,53 @@ DELETE_PASSWORD = os.getenv('DELETE_PASSWORD', '9com') # รหัสผ่า
 
 # ====== Django Channels / WebSocket ======
 # การตั้งค่า Channel Layer สำหรับการสื่อสารแบบ Real-time (WebSocket)
-CHANNEL_LAYERS = {
-    "default": {
-        # สำหรับพัฒนาบน Local 💻: ใช้ระบบหน่วยความจำภายในเครื่อง
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-        # สำหรับใช้งานจริงบน VPS 🐧 (Ubuntu): ให้เปลี่ยนไปใช้ Redis เพื่อรองรับผู้ใช้งานจำนวนมาก
-        # "BACKEND": "channels_redis.core.RedisChannelLayer",
-        # "CONFIG": { "hosts": [("127.0.0.1", 6373)], },
-    },
-}
+# REDIS_URL (เช่น redis://127.0.0.1:6379/0) ตั้งไว้ → ใช้ Redis ทั้ง channel layer และทะเบียนออนไลน์ของแชท
+# จำเป็นเมื่อรัน Daphne หลาย process — InMemoryChannelLayer ส่งข้อความได้เฉพาะใน process เดียวกัน
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            # สำหรับใช้งานจริงบน VPS 🐧 (Ubuntu): Redis รองรับผู้ใช้งานจำนวนมากและหลาย worker
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            # สำหรับพัฒนาบน Local 💻: ใช้ระบบหน่วยความจำภายในเครื่อง (Daphne process เดียว)
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# ทะเบียนผู้ใช้ออนไลน์ของห้องแชท (chat/presence.py): 'redis' หรือ 'memory'
+CHAT_PRESENCE_BACKEND = os.getenv('CHAT_PRESENCE_BACKEND', 'redis' if REDIS_URL else 'memory')
+CHAT_PRESENCE_TTL = int(os.getenv('CHAT_PRESENCE_TTL', '45'))              # วินาที (client ping ทุก 15 วินาที)
+CHAT_PRESENCE_DEBOUNCE = float(os.getenv('CHAT_PRESENCE_DEBOUNCE', '0.5'))  # รวบ broadcast รายชื่อออนไลน์ (วินาที)
+
+# บันทึกข้อความแชทเป็นชุด (chat/write_behind.py): รวบข้อความที่เข้ามาในช่วงนี้ / ครบจำนวนนี้เป็น DB hop เดียว
+CHAT_WRITE_BATCH_DELAY = float(os.getenv('CHAT_WRITE_BATCH_DELAY', '0.02'))  # วินาที
+CHAT_WRITE_BATCH_SIZE = int(os.getenv('CHAT_WRITE_BATCH_SIZE', '100'))
+
+# ====== แผนที่ GPS (pms/map_tiles.py) ======
+# แหล่ง tile: URL template ({z}/{x}/{y}) หรือโฟลเดอร์ tile ในเครื่อง — tile ที่ดึงมาเก็บไว้ใน MAP_TILE_CACHE_DIR
+MAP_TILE_SOURCE = os.getenv('MAP_TILE_SOURCE', 'https://tile.openstreetmap.org/{z}/{x}/{y}.png')
+MAP_TILE_CACHE_DIR = os.getenv('MAP_TILE_CACHE_DIR', str(BASE_DIR / 'cache' / 'map_tiles'))
+MAP_TILE_CACHE_MAX_MB = int(os.getenv('MAP_TILE_CACHE_MAX_MB', '200'))
+
+# ====== LLM Gateway (utils/llm_gateway.py) ======
+# ทุกการเรียก Gemini ผ่าน gateway เดียว: cache คำตอบตาม use case, รวม prompt ซ้ำที่กำลังรอ, จำกัดจำนวนเรียกพร้อมกัน
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')            # 'fake' = ไม่เรียก API จริง (test / offline)
+LLM_CACHE_STORE = os.getenv('LLM_CACHE_STORE', 'cache')     # 'cache' (Django cache) | 'analysis_cache' | 'none'
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))                  # ต่อ process
+LLM_MAX_CONCURRENCY_PER_USER = int(os.getenv('LLM_MAX_CONCURRENCY_PER_USER', '2'))
+LLM_QUEUE_TIMEOUT = int(os.getenv('LLM_QUEUE_TIMEOUT', '90'))                     # วินาที
+
+# ====== Stock Scanner Executor ======
+# งานคำนวณ indicator ต่อหุ้นของ scanner รันใน process pool แยกจาก Daphne (stocks/scan_executor.py)
+# 'thread' = รันใน thread ของ web process แบบเดิม (ใช้ตอน debug)
+SCAN_EXECUTOR = os.getenv('SCAN_EXECUTOR', 'process')
+SCAN_PROCESS_WORKERS = int(os.getenv('SCAN_PROCESS_WORKERS', '0')) or None  # None = จำนวน CPU - 1
 
 # ====== Upload Size Limits ======
 # กำหนดขนาดสูงสุดของไฟล์ที่อัปโหลดได้ (หน่วย: bytes)
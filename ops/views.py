@@ -259,8 +259,9 @@ def employee_create(request):
 
 @login_required
 def ai_analysis(request):
-    import google.genai as genai
     from django.conf import settings
+
+    from utils.llm_gateway import generate as llm_generate
     
     today = timezone.now().date()
     goals = WeeklyGoal.objects.filter(end_date__gte=today)
@@ -291,9 +292,7 @@ def ai_analysis(request):
         return render(request, 'ops/ai_result.html', {'error': "กรุณาตั้งค่า GEMINI_API_KEY ในระบบ"})
 
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        analysis = response.text
+        analysis = llm_generate(prompt, use_case='ops_report', model="gemini-2.5-flash", user=request.user)
     except Exception as e:
         analysis = f"เกิดข้อผิดพลาดในการติดต่อ AI: {str(e)}"
 
@@ -719,9 +718,10 @@ def execute_coworker(request):
         
     try:
         import os
-        import google.genai as genai
         from google.genai import types
         from django.conf import settings
+
+        from utils.llm_gateway import generate as llm_generate
         
         # ดึง API Key
         api_key = getattr(settings, "GEMINI_API_KEY", os.environ.get('GEMINI_API_KEY', None))
@@ -741,8 +741,6 @@ def execute_coworker(request):
         if agent_type != 'executive' and not input_text:
             return JsonResponse({'status': 'error', 'message': 'กรุณากรอกข้อมูลนำเข้าสำหรับเอเจนต์'}, status=400)
             
-        client = genai.Client(api_key=api_key)
-        
         # 1. จัดเตรียม System Instruction และ Prompt ตามเอเจนต์
         if agent_type == 'marketing':
             system_instruction = (
@@ -967,9 +965,11 @@ def execute_coworker(request):
             prompt = f"ข้อมูลดิบปฏิบัติงานจริงของสัปดาห์นี้:\n{context_data}"
 
         # เรียกใช้โมเดล Gemini API
-        response = client.models.generate_content(
+        response_text = llm_generate(
+            prompt,
+            use_case='ops_agent',
             model='gemini-2.5-flash',
-            contents=prompt,
+            user=request.user,
             config=types.GenerateContentConfig(
                 response_mime_type="application/json",
                 system_instruction=system_instruction,
@@ -978,7 +978,7 @@ def execute_coworker(request):
         )
         
         # แกะแปลงข้อมูล JSON
-        text_cleaned = response.text.strip()
+        text_cleaned = response_text.strip()
         if text_cleaned.startswith("```json"):
             text_cleaned = text_cleaned.replace("```json", "", 1)
         if text_cleaned.endswith("```"):
@@ -1,16 +1,18 @@
 import os
 
-import google.genai as genai
 from django.conf import settings
 
+from utils.llm_gateway import generate as llm_generate
+
+GEMINI_MODEL = 'gemini-3-flash-preview'
+
 
 # ฟังก์ชันส่งข้อมูลสรุปไปให้ Gemini AI เพื่อทำการวิเคราะห์เชิงกลยุทธ์และให้คำแนะนำทางธุรกิจ
-def get_gemini_analysis(data_summary):
+def get_gemini_analysis(data_summary, user=None):
     api_key = getattr(settings, "GEMINI_API_KEY", None)
     if not api_key:
         return "ไม่พบคีย์ Gemini API ในระบบ (GEMINI_API_KEY is missing in settings)"
 
-    client = genai.Client(api_key=api_key)
     prompt = f"""
     คุณคือผู้เชี่ยวชาญด้านการวิเคราะห์ข้อมูลธุรกิจ (Business Analyst) 
     นี่คือข้อมูลสรุปจากระบบบริหารโครงการ (Project Management System) ประจำเดือน/ปีที่เลือก:
@@ -27,13 +29,10 @@ def get_gemini_analysis(data_summary):
     """
     
     try:
-        response = client.models.generate_content(
-            model='gemini-3-flash-preview',
-            contents=prompt
-        )
-        if not response.text:
+        text = llm_generate(prompt, use_case='pms_report', model=GEMINI_MODEL, user=user)
+        if not text:
             return "AI ไม่ได้ตอบกลับข้อมูลใดๆ (Empty response from AI)"
-        return response.text
+        return text
     except Exception as e:
         error_msg = str(e)
         if "API_KEY_INVALID" in error_msg:
@@ -41,13 +40,8 @@ def get_gemini_analysis(data_summary):
         return f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ Gemini: {error_msg}"
 
 
-# ฟังก์ชันวิเคราะห์ประสิทธิภาพการทำงานภาคสนามด้วย Gemini AI
-def get_gemini_work_analysis(data_summary):
-    api_key = getattr(settings, "GEMINI_API_KEY", None)
-    if not api_key:
-        return "ไม่พบคีย์ Gemini API ในระบบ (GEMINI_API_KEY is missing in settings)"
-
-    client = genai.Client(api_key=api_key)
+# prompt วิเคราะห์สรุปงานช่าง — ใช้ร่วมกับ work_summary_ai_stream (SSE)
+def build_work_analysis_prompt(data_summary):
     prompt = f"""
     คุณคือผู้เชี่ยวชาญด้าน Field Service Management และการเพิ่มประสิทธิภาพการทำงานภาคสนาม
     นี่คือข้อมูลสรุปการทำงานของช่างภาคสนาม (Technician Work Summary) จากระบบ Check-in/Check-out:
@@ -82,15 +76,22 @@ def get_gemini_work_analysis(data_summary):
     ตอบเป็นภาษาไทย ใช้ภาษากระชับ เป็นมืออาชีพ จัดรูปแบบด้วย Markdown (หัวข้อ รายการ ตัวหนา)
     เน้นคำแนะนำที่นำไปปฏิบัติได้จริง (Actionable Insights)
     """
+    return prompt
+
+
+# ฟังก์ชันวิเคราะห์ประสิทธิภาพการทำงานภาคสนามด้วย Gemini AI
+def get_gemini_work_analysis(data_summary, user=None):
+    api_key = getattr(settings, "GEMINI_API_KEY", None)
+    if not api_key:
+        return "ไม่พบคีย์ Gemini API ในระบบ (GEMINI_API_KEY is missing in settings)"
+
+    prompt = build_work_analysis_prompt(data_summary)
 
     try:
-        response = client.models.generate_content(
-            model='gemini-3-flash-preview',
-            contents=prompt
-        )
-        if not response.text:
+        text = llm_generate(prompt, use_case='pms_report', model=GEMINI_MODEL, user=user)
+        if not text:
             return "AI ไม่ได้ตอบกลับข้อมูลใดๆ (Empty response from AI)"
-        return response.text
+        return text
     except Exception as e:
         error_msg = str(e)
         if "API_KEY_INVALID" in error_msg:
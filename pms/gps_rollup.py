@@ -0,0 +1,145 @@
+# ====== gps_rollup.py — ช่วงเวลาของรายงาน GPS + ตารางสรุป GPS ช่างรายวัน (TechnicianDaySummary) ======
+# เดิมรายงาน GPS ทุกหน้ากรองด้วย timestamp__date=... ซึ่งต้องแปลง timezone ของทุกแถวก่อนเทียบ (ใช้ index ไม่ได้)
+# และรายงานรายเดือน / กราฟสถิติช่าง 12 เดือน อ่าน log ดิบทั้งช่วงมาจัดกลุ่มใน Python ทุกครั้งที่เปิดหน้า
+#
+# โมดูลนี้:
+#   - day_filter / period_filter: เงื่อนไขช่วงเวลาแบบครึ่งเปิด [เที่ยงคืนวันแรก, เที่ยงคืนหลังวันสุดท้าย)
+#     ตามเวลาท้องถิ่น — ใช้ index (user, timestamp) / (timestamp) ของ TechnicianGPSLog ได้ตรงๆ
+#   - summarize: สรุป log ของช่างหนึ่งคนในหนึ่งวัน (จำนวนแต่ละประเภท, งานที่จับคู่ได้, ระยะทาง)
+#   - refresh_days: คำนวณแถวของ (ช่าง, วัน) ที่ระบุใหม่จาก log ดิบทั้งวัน ภายใต้ล็อกของคู่นั้น
+#     (pms/signals.py เรียกหลัง commit ครั้งเดียวต่อทรานแซกชัน เมื่อมี log เข้า/ถูกลบ)
+#   - rebuild: สร้างตารางสรุปใหม่ทั้งหมด (python manage.py rebuild_gps_rollup)
+
+import datetime
+from math import atan2, cos, radians, sin, sqrt
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.day_rollup import lock
+
+START_TYPES = ('ON_SITE', 'CHECK_IN')
+_COUNT_FIELDS = {
+    'GO_WORK': 'go_work_count',
+    'ON_SITE': 'on_site_count',
+    'CHECK_IN': 'check_in_count',
+    'CHECK_OUT': 'check_out_count',
+    'BACK_OFFICE': 'back_office_count',
+    'TRAVEL': 'travel_count',
+}
+
+
+def local_day(dt):
+    return timezone.localdate(dt) if timezone.is_aware(dt) else dt.date()
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def period_filter(start_day, end_day, field='timestamp'):
+    """เงื่อนไข filter ของช่วงวันที่ (รวมทั้งสองวัน) เช่น TechnicianGPSLog.objects.filter(**period_filter(a, b))"""
+    return {
+        f'{field}__gte': _midnight(start_day),
+        f'{field}__lt': _midnight(end_day + datetime.timedelta(days=1)),
+    }
+
+
+def day_filter(day, field='timestamp'):
+    return period_filter(day, day, field)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    R = 6371.0
+    dlat, dlon = radians(lat2 - lat1), radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return R * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+def summarize(logs):
+    """
+    logs: (check_type, timestamp, latitude, longitude) ของช่างหนึ่งคนในหนึ่งวัน เรียงตามเวลา
+    งาน = ON_SITE / CHECK_IN จับคู่กับ CHECK_OUT ถัดไปแบบมาก่อนได้ก่อน (เหมือน work_summary_report)
+    ระยะทาง = ผลรวมระยะระหว่างพิกัดที่ต่อกัน (ข้ามพิกัด 0)
+    """
+    row = {field: 0 for field in _COUNT_FIELDS.values()}
+    row.update(log_count=0, work_sessions=0, work_minutes=0, distance_km=0.0, first_at=None, last_at=None)
+    pending = []
+    prev_point = None
+    for check_type, ts, lat, lon in logs:
+        row['log_count'] += 1
+        if row['first_at'] is None:
+            row['first_at'] = ts
+        row['last_at'] = ts
+        if check_type in _COUNT_FIELDS:
+            row[_COUNT_FIELDS[check_type]] += 1
+        if check_type in START_TYPES:
+            pending.append(ts)
+        elif check_type == 'CHECK_OUT' and pending:
+            started = pending.pop(0)
+            row['work_sessions'] += 1
+            row['work_minutes'] += max(0, int((ts - started).total_seconds() / 60))
+        if lat and lon and float(lat) != 0 and float(lon) != 0:
+            point = (float(lat), float(lon))
+            if prev_point is not None:
+                row['distance_km'] += haversine_km(*prev_point, *point)
+            prev_point = point
+    row['distance_km'] = round(row['distance_km'], 3)
+    return row
+
+
+def _summaries(logs):
+    """logs: (user_id, check_type, timestamp, lat, lon) เรียงตาม user, เวลา — Returns: {(user_id, day): row}"""
+    grouped = {}
+    for user_id, check_type, ts, lat, lon in logs:
+        grouped.setdefault((user_id, local_day(ts)), []).append((check_type, ts, lat, lon))
+    return {key: summarize(day_logs) for key, day_logs in grouped.items()}
+
+
+def _log_rows(queryset):
+    return queryset.order_by('user_id', 'timestamp', 'id').values_list(
+        'user_id', 'check_type', 'timestamp', 'latitude', 'longitude'
+    )
+
+
+def _write(summaries):
+    from pms.models import TechnicianDaySummary
+
+    TechnicianDaySummary.objects.bulk_create(
+        [TechnicianDaySummary(user_id=user_id, day=day, **row) for (user_id, day), row in summaries.items()],
+        batch_size=1000,
+    )
+
+
+def refresh_days(pairs):
+    """
+    pairs: (user_id, day) — คำนวณแถวสรุปของคู่ที่ระบุใหม่ทั้งวัน
+    ล็อก (ช่าง, วัน) ก่อนอ่าน log — สองทรานแซกชันที่คำนวณคู่เดียวกันพร้อมกันต่อคิวกัน ไม่ชน unique (user, day)
+    """
+    from pms.models import TechnicianDaySummary, TechnicianGPSLog
+
+    pairs = {(user_id, day) for user_id, day in pairs if user_id and day}
+    if not pairs:
+        return
+    in_days = Q()
+    stale = Q()
+    for user_id, day in pairs:
+        in_days |= Q(user_id=user_id, **day_filter(day))
+        stale |= Q(user_id=user_id, day=day)
+    with transaction.atomic():
+        lock('pms_gps', pairs)
+        summaries = _summaries(_log_rows(TechnicianGPSLog.objects.filter(in_days)))
+        TechnicianDaySummary.objects.filter(stale).delete()
+        _write(summaries)
+
+
+def rebuild():
+    """สร้างตารางสรุปใหม่ทั้งหมด — Returns: จำนวนแถว"""
+    from pms.models import TechnicianDaySummary, TechnicianGPSLog
+
+    summaries = _summaries(_log_rows(TechnicianGPSLog.objects.all()).iterator(chunk_size=5000))
+    with transaction.atomic():
+        TechnicianDaySummary.objects.all().delete()
+        _write(summaries)
+    return len(summaries)
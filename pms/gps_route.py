@@ -0,0 +1,167 @@
+# ====== gps_route.py — เส้นทาง GPS แบบย่อสำหรับแผนที่ (gps_tracking_report / gps_live_data / gps_map_embed) ======
+# เดิมทั้งสามหน้าส่งทุกจุด TRAVEL ของ Auto-Track เป็น dict เต็ม (สี / ไอคอน / ชื่อประเภทซ้ำทุกจุด) และสร้าง marker ทุกจุด
+# ช่างที่เปิด Auto-Track ทั้งวันมีหลายพันจุด — หน้าแผนที่และ live poll (ทุก 15 วินาที) หนักขึ้นเรื่อยๆ ตามเวลา
+#
+# โมดูลนี้:
+#   - simplify: ลดจุดของเส้นทางด้วย Douglas–Peucker โดยระยะคลาดเคลื่อนเทียบเท่า ~1.5 พิกเซลที่ระดับซูมที่ใช้ดู
+#   - encode_polyline / Google encoded polyline (precision 5) — พิกัดหนึ่งจุดเหลือไม่กี่ไบต์
+#   - route_payload: ข้อมูลแผนที่ของช่างหนึ่งคน = เส้นทาง (encoded) + จุดหยุด (ทุกประเภทยกเว้น TRAVEL) + จุดล่าสุด
+#     live poll ส่งเฉพาะ log ที่ใหม่กว่า since_id (client ต่อท้ายเส้นเดิม) — payload ไม่โตตามเวลา
+
+import math
+
+from django.utils import timezone
+
+TRAVEL = 'TRAVEL'
+MAX_ZOOM = 18
+ZOOM_HEADROOM = 2   # เก็บรายละเอียดไว้สำหรับซูมเข้าเพิ่มจากระดับที่พอดีกับเส้นทางอีก 2 ระดับ
+_EARTH_M = 6378137.0
+
+
+def _project(lat, lng):
+    """พิกัด → เมตร (Web Mercator) สำหรับวัดระยะห่างจากเส้น"""
+    x = math.radians(lng) * _EARTH_M
+    y = math.log(math.tan(math.pi / 4 + math.radians(max(min(lat, 85.0), -85.0)) / 2)) * _EARTH_M
+    return x, y
+
+
+def fit_zoom(coords, width_px=800, height_px=600):
+    """ระดับซูมสูงสุดที่ทั้งเส้นทางอยู่ในกรอบ width × height พิกเซล"""
+    if len(coords) < 2:
+        return 16
+    xs, ys = zip(*(_project(lat, lng) for lat, lng in coords))
+    span_x = max(xs) - min(xs)
+    span_y = max(ys) - min(ys)
+    world = 2 * math.pi * _EARTH_M
+    for zoom in range(MAX_ZOOM, 0, -1):
+        m_per_px = world / (256 * 2 ** zoom)
+        if span_x / m_per_px <= width_px and span_y / m_per_px <= height_px:
+            return zoom
+    return 1
+
+
+def tolerance_for_zoom(zoom):
+    """ระยะคลาดเคลื่อน (เมตรบนแผนที่ Mercator) ที่มองไม่เห็นบนจอ ≈ 1.5 พิกเซลที่ระดับซูมนั้น"""
+    return 1.5 * 2 * math.pi * _EARTH_M / (256 * 2 ** zoom)
+
+
+def simplify(coords, zoom=None):
+    """
+    coords: [(lat, lng)] — Returns: รายการย่อยของ coords (จุดแรก/จุดสุดท้ายอยู่เสมอ)
+    zoom: ระดับซูมที่ต้องการให้เส้นดูเหมือนเดิม (None = fit_zoom ของเส้นทาง + ZOOM_HEADROOM)
+    """
+    if len(coords) < 3:
+        return list(coords)
+    if zoom is None:
+        zoom = min(MAX_ZOOM, fit_zoom(coords) + ZOOM_HEADROOM)
+    tol = tolerance_for_zoom(zoom)
+    pts = [_project(lat, lng) for lat, lng in coords]
+
+    keep = [False] * len(pts)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = pts[first], pts[last]
+        dx, dy = x2 - x1, y2 - y1
+        seg = math.hypot(dx, dy)
+        worst, worst_i = 0.0, None
+        for i in range(first + 1, last):
+            px, py = pts[i]
+            if seg == 0:
+                d = math.hypot(px - x1, py - y1)
+            else:
+                d = abs(dy * px - dx * py + x2 * y1 - y2 * x1) / seg
+            if d > worst:
+                worst, worst_i = d, i
+        if worst_i is not None and worst > tol:
+            keep[worst_i] = True
+            stack.append((first, worst_i))
+            stack.append((worst_i, last))
+    return [c for c, k in zip(coords, keep) if k]
+
+
+def encode_polyline(coords, precision=5):
+    """Google encoded polyline algorithm format"""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coords:
+        ilat, ilng = round(lat * factor), round(lng * factor)
+        for delta in (ilat - prev_lat, ilng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lng = ilat, ilng
+    return ''.join(out)
+
+
+def decode_polyline(encoded, precision=5):
+    factor = 10 ** precision
+    coords = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        for axis in range(2):
+            shift = result = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if axis == 0:
+                lat += delta
+            else:
+                lng += delta
+        coords.append((lat / factor, lng / factor))
+    return coords
+
+
+def _has_coords(log):
+    return not (float(log.latitude) == 0 and float(log.longitude) == 0)
+
+
+def _stop(log, n, job=False):
+    stop = {
+        'id': log.id,
+        'n': n,
+        'lat': float(log.latitude),
+        'lng': float(log.longitude),
+        'type': log.check_type,
+        'time': timezone.localtime(log.timestamp).strftime('%H:%M'),
+        'location': log.location_name or '',
+        'notes': log.notes or '',
+    }
+    if job:
+        stop['job'] = log.queue_item.project.name if log.queue_item and log.queue_item.project else '-'
+    return stop
+
+
+def route_payload(logs, zoom=None, job=False, offset=0):
+    """
+    logs: TechnicianGPSLog ของช่างหนึ่งคน เรียงตามเวลา (live poll: เฉพาะ log ที่ id มากกว่าที่ client มีแล้ว
+          — 'route' เป็นส่วนต่อท้ายของเส้นเดิม)
+    offset: จำนวน log ก่อนหน้า logs (ใช้ต่อเลขลำดับ n ของจุดตอน live poll)
+    Returns: {'route': encoded polyline, 'stops': [จุดที่ไม่ใช่ TRAVEL], 'last': จุดล่าสุด, 'last_id', 'count'}
+    """
+    stops = []
+    coords = []
+    last = None
+    for n, log in enumerate(logs, offset):
+        if not _has_coords(log):
+            continue
+        coords.append((float(log.latitude), float(log.longitude)))
+        last = _stop(log, n, job)
+        if log.check_type != TRAVEL:
+            stops.append(last)
+    return {
+        'route': encode_polyline(simplify(coords, zoom)),
+        'stops': stops,
+        'last': last,
+        'last_id': max((log.id for log in logs), default=None),
+        'count': offset + len(logs),
+    }
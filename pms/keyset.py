@@ -0,0 +1,66 @@
+# ====== keyset.py — keyset (cursor) pagination สำหรับ project_list / history_list ======
+# เดิมทั้งสองหน้าส่ง queryset ของทุกโครงการให้ template render ในครั้งเดียว — เวลา render และหน่วยความจำโตตามจำนวนงาน
+# OFFSET ก็ช้าลงเรื่อยๆ เมื่อเลื่อนลึก และรายการเลื่อน/ซ้ำเมื่อมีงานใหม่เข้ามาระหว่างเลื่อนดู
+#
+# โมดูลนี้:
+#   - paginate: ดึงหน้าถัดไปต่อจาก cursor ด้วย WHERE (sort_key, pk) < / > ค่าสุดท้าย (ไม่ใช้ OFFSET)
+#     view ต้อง annotate คอลัมน์ sort_key ให้ queryset ก่อน (ไม่เป็น NULL) — pk ใช้ตัดสินเมื่อค่าเท่ากัน
+#   - cursor เป็น token ที่ลงลายเซ็นไว้ (django.core.signing) ผูกกับคีย์การเรียง — ถ้าเปลี่ยนการเรียงหรือ token เสีย
+#     จะเริ่มจากหน้าแรกใหม่
+
+import datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+PAGE_SIZE = 50
+_SALT = 'pms.keyset'
+
+
+def _plain(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(sort_by, value, pk):
+    return signing.dumps([sort_by, _plain(value), pk], salt=_SALT)
+
+
+def decode_cursor(token, sort_by):
+    """Returns: (ค่า sort_key, pk) ของแถวสุดท้าย หรือ None ถ้า token ไม่ถูกต้อง / เป็นของการเรียงแบบอื่น"""
+    if not token:
+        return None
+    try:
+        cursor_sort, value, pk = signing.loads(token, salt=_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if cursor_sort != sort_by:
+        return None
+    return value, pk
+
+
+def paginate(queryset, sort_by, descending, cursor=None, page_size=PAGE_SIZE):
+    """
+    queryset: ต้องมี annotation sort_key
+    Returns: (รายการแถวไม่เกิน page_size, cursor ของหน้าถัดไป หรือ None ถ้าหมดแล้ว)
+    """
+    prefix = '-' if descending else ''
+    queryset = queryset.order_by(f'{prefix}sort_key', f'{prefix}pk')
+
+    last = decode_cursor(cursor, sort_by)
+    if last:
+        value, pk = last
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'sort_key__{op}': value}) | Q(sort_key=value, **{f'pk__{op}': pk})
+        )
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(sort_by, rows[-1].sort_key, rows[-1].pk)
@@ -0,0 +1,17 @@
+"""
+python manage.py rebuild_gps_rollup
+
+สร้างตารางสรุป GPS ช่างรายวัน (TechnicianDaySummary) ใหม่ทั้งหมดจาก TechnicianGPSLog
+ปกติตารางถูกอัปเดตเองเมื่อมี log เข้า/ถูกลบ — ใช้คำสั่งนี้เมื่อข้อมูลถูกแก้ตรงใน DB
+"""
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'สร้างตารางสรุป GPS ช่างรายวัน (TechnicianDaySummary) ใหม่ทั้งหมด'
+
+    def handle(self, *args, **options):
+        from pms.gps_rollup import rebuild
+
+        rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'TechnicianDaySummary: {rows} แถว'))
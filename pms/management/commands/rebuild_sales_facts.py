@@ -0,0 +1,17 @@
+"""
+python manage.py rebuild_sales_facts
+
+คำนวณ Project.total_value ของทุกโครงการ และสร้างตารางสรุปยอดขายรายวัน (ProjectSalesFact) ใหม่ทั้งหมด
+ปกติตารางถูกอัปเดตเองเมื่อ Project / ProductItem ถูกบันทึก — ใช้คำสั่งนี้เมื่อข้อมูลถูกแก้ตรงใน DB
+"""
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'คำนวณมูลค่าโครงการ + ตารางสรุปยอดขายรายวัน (ProjectSalesFact) ใหม่ทั้งหมด'
+
+    def handle(self, *args, **options):
+        from pms.sales_facts import rebuild
+
+        rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'ProjectSalesFact: {rows} แถว'))
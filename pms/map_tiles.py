@@ -0,0 +1,184 @@
+# ====== map_tiles.py — แหล่งและ cache ของ tile แผนที่ (OSM) สำหรับ gps_map_image ======
+# เดิม gps_map_image ดาวน์โหลด tile ~20 ภาพจาก tile.openstreetmap.org ทีละภาพใน request thread ทุกครั้งที่มีคนเปิดรูป
+# (รูปแผนที่ในห้องแชทถูกโหลดซ้ำทุกครั้งที่เปิดห้อง) — ช้า และเสี่ยงโดน OSM จำกัดการใช้งาน
+#
+# โมดูลนี้:
+#   - HttpTileSource / DirectoryTileSource: แหล่ง tile ตาม settings.MAP_TILE_SOURCE
+#     (URL template เช่น https://tile.openstreetmap.org/{z}/{x}/{y}.png หรือโฟลเดอร์ tile ในเครื่อง — ใช้ใน test ได้)
+#   - TileCache.get_many: อ่าน tile จากโฟลเดอร์ cache ก่อน ที่ขาดดึงจากแหล่งพร้อมกัน (thread pool) แล้วเขียนเก็บ
+#     จำกัดขนาดรวมด้วย MAP_TILE_CACHE_MAX_MB — เกินแล้วลบไฟล์ที่ถูกใช้ล่าสุดนานที่สุดก่อน (LRU ตาม mtime)
+#   - rendered_key / get_rendered / set_rendered: cache รูป PNG ที่วาดเสร็จแล้วของ (ช่าง, วัน, log ล่าสุด)
+#     เปิดรูปเดิมซ้ำจึงไม่ต้องวาดใหม่และไม่มีการเรียก network
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FETCH_WORKERS = 8
+RENDERED_TTL = 60 * 60 * 24 * 7  # 7 วัน
+
+
+class HttpTileSource:
+    """ดึง tile จาก tile server ตาม URL template ({z}, {x}, {y})"""
+
+    headers = {'User-Agent': 'PMS-GPS-Report/1.0 (internal app)'}
+
+    def __init__(self, url_template, timeout=4):
+        self.url_template = url_template
+        self.timeout = timeout
+
+    def fetch(self, z, x, y):
+        import requests
+
+        r = requests.get(self.url_template.format(z=z, x=x, y=y), headers=self.headers, timeout=self.timeout)
+        return r.content if r.status_code == 200 else None
+
+
+class DirectoryTileSource:
+    """อ่าน tile จากโฟลเดอร์ในเครื่อง (<root>/{z}/{x}/{y}.png)"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def fetch(self, z, x, y):
+        path = self.root / str(z) / str(x) / f'{y}.png'
+        return path.read_bytes() if path.exists() else None
+
+
+def get_tile_source():
+    source = getattr(settings, 'MAP_TILE_SOURCE', 'https://tile.openstreetmap.org/{z}/{x}/{y}.png')
+    if source.startswith(('http://', 'https://')):
+        return HttpTileSource(source)
+    return DirectoryTileSource(source)
+
+
+class TileCache:
+    """cache tile บนดิสก์ (<root>/{z}/{x}/{y}.png) จำกัดขนาดรวม max_bytes"""
+
+    def __init__(self, root, max_bytes, source):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.source = source
+        self._size = None   # ขนาดรวมโดยประมาณ — สแกนโฟลเดอร์ครั้งแรกที่เขียน
+        self._lock = threading.Lock()
+
+    def _path(self, z, x, y):
+        return self.root / str(z) / str(x) / f'{y}.png'
+
+    def _read(self, path):
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)   # ใช้ล่าสุด → อยู่ท้ายคิว LRU
+        except OSError:
+            pass
+        return data
+
+    def _fetch(self, z, x, y):
+        try:
+            return self.source.fetch(z, x, y)
+        except Exception as e:
+            logger.warning("map tile fetch failed %s/%s/%s: %s", z, x, y, e)
+            return None
+
+    def get_many(self, z, coords):
+        """coords: [(x, y)] — Returns: {(x, y): PNG bytes} เฉพาะ tile ที่ได้มา"""
+        tiles = {}
+        missing = []
+        for x, y in coords:
+            data = self._read(self._path(z, x, y))
+            if data is None:
+                missing.append((x, y))
+            else:
+                tiles[(x, y)] = data
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(missing))) as ex:
+                fetched = ex.map(lambda xy: self._fetch(z, *xy), missing)
+                for (x, y), data in zip(missing, fetched):
+                    if data:
+                        tiles[(x, y)] = data
+                        self._store(self._path(z, x, y), data)
+        return tiles
+
+    def _store(self, path, data):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("map tile cache write failed %s: %s", path, e)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(f.stat().st_size for f in self.root.rglob('*.png'))
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """ลบ tile ที่ใช้ล่าสุดนานที่สุดจนเหลือ 90% ของขนาดที่กำหนด"""
+        files = []
+        for f in self.root.rglob('*.png'):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, f in files:
+            if total <= target:
+                break
+            try:
+                f.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+
+def get_tile_cache():
+    global _tile_cache
+    if _tile_cache is None:
+        with _tile_cache_lock:
+            if _tile_cache is None:
+                _tile_cache = TileCache(
+                    getattr(settings, 'MAP_TILE_CACHE_DIR', Path(settings.BASE_DIR) / 'cache' / 'map_tiles'),
+                    getattr(settings, 'MAP_TILE_CACHE_MAX_MB', 200) * 1024 * 1024,
+                    get_tile_source(),
+                )
+    return _tile_cache
+
+
+# ====== รูปแผนที่ที่วาดเสร็จแล้ว ======
+
+def rendered_key(user_id, day, last_log_id, log_count):
+    # จำนวน log อยู่ในคีย์ด้วย — ลบ log กลางวันแล้วรูปต้องเปลี่ยนแม้ log ล่าสุดเหมือนเดิม
+    return f'pms:gps_map:{user_id}:{day.isoformat()}:{last_log_id}:{log_count}'
+
+
+def get_rendered(key):
+    from django.core.cache import cache
+
+    return cache.get(key)
+
+
+def set_rendered(key, png):
+    from django.core.cache import cache
+
+    cache.set(key, png, RENDERED_TTL)
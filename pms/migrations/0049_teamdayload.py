@@ -0,0 +1,70 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:12
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_team_day_loads(apps, schema_editor):
+    # สร้าง index จากงาน SCHEDULED / IN_PROGRESS ที่มีอยู่แล้ว (ตรรกะเดียวกับ pms.team_load.refresh_team_day_loads)
+    ServiceQueueItem = apps.get_model('pms', 'ServiceQueueItem')
+    TeamDayLoad = apps.get_model('pms', 'TeamDayLoad')
+    rows = ServiceQueueItem.assigned_teams.through.objects.filter(
+        servicequeueitem__scheduled_date__isnull=False,
+        servicequeueitem__status__in=['SCHEDULED', 'IN_PROGRESS'],
+    ).values_list(
+        'serviceteam_id', 'servicequeueitem__scheduled_date',
+        'servicequeueitem__scheduled_time', 'servicequeueitem__estimated_hours',
+    )
+    count = defaultdict(int)
+    hours = defaultdict(Decimal)
+    slot_end = defaultdict(lambda: 8 * 60 + 30)
+    untimed = defaultdict(int)
+    for team_id, date, start, est in rows:
+        key = (team_id, date)
+        est = est or Decimal('0')
+        count[key] += 1
+        hours[key] += est
+        if start:
+            slot_end[key] = max(slot_end[key], start.hour * 60 + start.minute + int(est * 60))
+        else:
+            untimed[key] += int(est * 60)
+    loads = []
+    for (team_id, date), n in count.items():
+        minutes = min(slot_end[(team_id, date)] + untimed[(team_id, date)], 23 * 60 + 59)
+        loads.append(TeamDayLoad(
+            team_id=team_id, date=date, task_count=n, booked_hours=hours[(team_id, date)],
+            next_slot=datetime.time(minutes // 60, minutes % 60),
+        ))
+    TeamDayLoad.objects.bulk_create(loads, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pms', '0048_add_hidden_rate_field'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamDayLoad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='วันที่')),
+                ('task_count', models.PositiveIntegerField(default=0, verbose_name='จำนวนงาน')),
+                ('booked_hours', models.DecimalField(decimal_places=1, default=0, max_digits=5, verbose_name='ชั่วโมงที่จองแล้ว')),
+                ('next_slot', models.TimeField(verbose_name='เวลาว่างถัดไป')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_loads', to='pms.serviceteam', verbose_name='ทีม')),
+            ],
+            options={
+                'verbose_name': 'ภาระงานทีมรายวัน',
+                'verbose_name_plural': 'ภาระงานทีมรายวัน',
+                'unique_together': {('team', 'date')},
+            },
+        ),
+        migrations.RunPython(populate_team_day_loads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 6.0.1 on 2026-10-17 08:40
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def populate_sales_facts(apps, schema_editor):
+    # total_value ของโครงการเดิม + ตารางสรุปรายวัน (ตรรกะเดียวกับ pms.sales_facts.rebuild)
+    Project = apps.get_model('pms', 'Project')
+    ProductItem = apps.get_model('pms', 'ProductItem')
+    ProjectSalesFact = apps.get_model('pms', 'ProjectSalesFact')
+    money = DecimalField(max_digits=15, decimal_places=2)
+
+    total = (
+        ProductItem.objects.filter(project=OuterRef('pk')).order_by()
+        .values('project').annotate(total=Sum(F('quantity') * F('unit_price'))).values('total')
+    )
+    Project.objects.update(total_value=Coalesce(Subquery(total, output_field=money), Value(Decimal('0')), output_field=money))
+
+    facts = defaultdict(lambda: defaultdict(Decimal))
+    rows = Project.objects.values_list('job_type', 'owner_id', 'status', 'total_value', 'created_at', 'closed_at')
+    for job_type, owner_id, status, value, created_at, closed_at in rows.iterator(chunk_size=2000):
+        fact = facts[(timezone.localdate(created_at), job_type, owner_id or 0)]
+        fact['created_count'] += 1
+        fact['created_value'] += value
+        if closed_at and status in ('CLOSED', 'CANCELLED'):
+            prefix = 'closed' if status == 'CLOSED' else 'cancelled'
+            fact = facts[(timezone.localdate(closed_at), job_type, owner_id or 0)]
+            fact[f'{prefix}_count'] += 1
+            fact[f'{prefix}_value'] += value
+    ProjectSalesFact.objects.bulk_create([
+        ProjectSalesFact(day=day, job_type=job_type, owner_id=owner_id, **{
+            field: int(v) if field.endswith('_count') else v for field, v in values.items()
+        })
+        for (day, job_type, owner_id), values in facts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pms', '0049_teamdayload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='total_value',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15, verbose_name='มูลค่ารวม'),
+        ),
+        migrations.CreateModel(
+            name='ProjectSalesFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='วันที่')),
+                ('job_type', models.CharField(max_length=20, verbose_name='ประเภทงาน')),
+                ('owner_id', models.PositiveIntegerField(default=0, verbose_name='เจ้าของโครงการ')),
+                ('created_count', models.PositiveIntegerField(default=0)),
+                ('created_value', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('closed_count', models.PositiveIntegerField(default=0)),
+                ('closed_value', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('cancelled_count', models.PositiveIntegerField(default=0)),
+                ('cancelled_value', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+            ],
+            options={
+                'verbose_name': 'สรุปยอดขายรายวัน',
+                'verbose_name_plural': 'สรุปยอดขายรายวัน',
+                'unique_together': {('day', 'job_type', 'owner_id')},
+            },
+        ),
+        migrations.RunPython(populate_sales_facts, migrations.RunPython.noop),
+    ]
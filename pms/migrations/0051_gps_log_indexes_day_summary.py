@@ -0,0 +1,114 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:20
+
+from math import atan2, cos, radians, sin, sqrt
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_gps_day_summary(apps, schema_editor):
+    # สรุป GPS log เดิมรายช่างรายวัน (ตรรกะเดียวกับ pms.gps_rollup.rebuild)
+    TechnicianGPSLog = apps.get_model('pms', 'TechnicianGPSLog')
+    TechnicianDaySummary = apps.get_model('pms', 'TechnicianDaySummary')
+    count_fields = {
+        'GO_WORK': 'go_work_count', 'ON_SITE': 'on_site_count', 'CHECK_IN': 'check_in_count',
+        'CHECK_OUT': 'check_out_count', 'BACK_OFFICE': 'back_office_count', 'TRAVEL': 'travel_count',
+    }
+
+    def km(p1, p2):
+        dlat, dlon = radians(p2[0] - p1[0]), radians(p2[1] - p1[1])
+        a = sin(dlat / 2) ** 2 + cos(radians(p1[0])) * cos(radians(p2[0])) * sin(dlon / 2) ** 2
+        return 6371.0 * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+    days = {}
+    rows = TechnicianGPSLog.objects.order_by('user_id', 'timestamp', 'id').values_list(
+        'user_id', 'check_type', 'timestamp', 'latitude', 'longitude'
+    )
+    for user_id, check_type, ts, lat, lon in rows.iterator(chunk_size=5000):
+        key = (user_id, timezone.localdate(ts))
+        if key not in days:
+            days[key] = {'row': dict.fromkeys(count_fields.values(), 0) | {
+                'log_count': 0, 'work_sessions': 0, 'work_minutes': 0, 'distance_km': 0.0,
+                'first_at': ts, 'last_at': ts,
+            }, 'pending': [], 'prev': None}
+        state = days[key]
+        row = state['row']
+        row['log_count'] += 1
+        row['last_at'] = ts
+        if check_type in count_fields:
+            row[count_fields[check_type]] += 1
+        if check_type in ('ON_SITE', 'CHECK_IN'):
+            state['pending'].append(ts)
+        elif check_type == 'CHECK_OUT' and state['pending']:
+            started = state['pending'].pop(0)
+            row['work_sessions'] += 1
+            row['work_minutes'] += max(0, int((ts - started).total_seconds() / 60))
+        if lat and lon and float(lat) != 0 and float(lon) != 0:
+            point = (float(lat), float(lon))
+            if state['prev'] is not None:
+                row['distance_km'] += km(state['prev'], point)
+            state['prev'] = point
+    TechnicianDaySummary.objects.bulk_create([
+        TechnicianDaySummary(user_id=user_id, day=day, **(state['row'] | {
+            'distance_km': round(state['row']['distance_km'], 3),
+        }))
+        for (user_id, day), state in days.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pms', '0050_project_total_value_sales_facts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TechnicianDaySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='วันที่')),
+                ('first_at', models.DateTimeField(verbose_name='log แรก')),
+                ('last_at', models.DateTimeField(verbose_name='log สุดท้าย')),
+                ('log_count', models.PositiveIntegerField(default=0)),
+                ('go_work_count', models.PositiveIntegerField(default=0)),
+                ('on_site_count', models.PositiveIntegerField(default=0)),
+                ('check_in_count', models.PositiveIntegerField(default=0)),
+                ('check_out_count', models.PositiveIntegerField(default=0)),
+                ('back_office_count', models.PositiveIntegerField(default=0)),
+                ('travel_count', models.PositiveIntegerField(default=0)),
+                ('work_sessions', models.PositiveIntegerField(default=0)),
+                ('work_minutes', models.PositiveIntegerField(default=0)),
+                ('distance_km', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'สรุป GPS ช่างรายวัน',
+                'verbose_name_plural': 'สรุป GPS ช่างรายวัน',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='techniciangpslog',
+            index=models.Index(fields=['user', 'timestamp'], name='gpslog_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='techniciangpslog',
+            index=models.Index(fields=['timestamp'], name='gpslog_ts_idx'),
+        ),
+        migrations.AddField(
+            model_name='techniciandaysummary',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gps_days', to=settings.AUTH_USER_MODEL, verbose_name='ช่าง'),
+        ),
+        migrations.AddIndex(
+            model_name='techniciandaysummary',
+            index=models.Index(fields=['day'], name='gpsday_day_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='techniciandaysummary',
+            unique_together={('user', 'day')},
+        ),
+        migrations.RunPython(populate_gps_day_summary, migrations.RunPython.noop),
+    ]
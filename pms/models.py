@@ -182,6 +182,8 @@ class Project(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     closed_at = models.DateTimeField(null=True, blank=True, verbose_name="วันที่ปิดจบงาน")
+    # ผลรวม quantity × unit_price ของ items — อัปเดตเมื่อ ProductItem เปลี่ยน (pms/sales_facts.py) ไม่ต้อง join ตอนรายงาน
+    total_value = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False, verbose_name="มูลค่ารวม")
 
     # SLA Tracking (Starts from project creation)
     sla_response_deadline = models.DateTimeField(null=True, blank=True, verbose_name="เส้นตายการตอบกลับ")
@@ -196,6 +198,7 @@ class Project(models.Model):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._old_status = self.status
+        self._old_closed_at = self.closed_at
 
     def __str__(self):
         return self.name
@@ -216,6 +219,9 @@ class Project(models.Model):
             
         is_new = self.pk is None
         old_status = getattr(self, '_old_status', self.status)
+        if not is_new:
+            # instance ที่โหลดไว้ก่อนเพิ่ม/แก้ items อาจถือ total_value เก่า — คำนวณจาก DB ก่อนบันทึกทับ
+            self.total_value = self.compute_total_value()
 
         # 3. กลไกการล็อกสถานะสำหรับ AI Queue
         # ทุก status_key ที่ขึ้นต้นด้วย QUEUE_ ถือเป็น "สถานะคิว" โดย convention
@@ -285,10 +291,10 @@ class Project(models.Model):
             
         self._old_status = self.status
 
-    # คืนค่ามูลค่ารวมของโครงการ (ผลรวมของยอดขายแต่ละรายการ)
-    @property
-    def total_value(self):
-        return sum(item.total_price for item in self.items.all())
+    # คำนวณมูลค่ารวมของโครงการ (ผลรวมของยอดขายแต่ละรายการ) จาก DB — ค่าที่เก็บไว้คือฟิลด์ total_value
+    def compute_total_value(self):
+        total = self.items.aggregate(total=models.Sum(models.F('quantity') * models.F('unit_price')))['total']
+        return total or Decimal('0')
 
     # คืนค่าชื่อสถานะที่แสดงผล โดยดึงจากฐานข้อมูล (dynamic) หรือค่าทางเลือกที่กำหนดไว้
     @property
@@ -1117,9 +1123,17 @@ class ServiceQueueItem(models.Model):
         verbose_name_plural = "คิวงานบริการ"
         ordering = ['priority', 'deadline', 'created_at']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ค่าที่มีผลต่อ TeamDayLoad ตอนโหลดจาก DB — post_save ใช้ตัดสินว่าต้องคำนวณ index ใหม่หรือไม่
+        self._old_schedule = self.schedule_state()
+
     def __str__(self):
         return f"[{self.get_priority_display()}] {self.title}"
 
+    def schedule_state(self):
+        return (self.status, self.scheduled_date, self.scheduled_time, self.estimated_hours)
+
     def save(self, *args, **kwargs):
         # 1. Handle Completion
         old_status = None
@@ -1159,6 +1173,56 @@ class ServiceQueueItem(models.Model):
         return None
 
 
+class ProjectSalesFact(models.Model):
+    """
+    ตารางสรุปยอดขายรายวัน แยกตาม ประเภทงาน × เจ้าของโครงการ (pms/sales_facts.py)
+    - created_*   : โครงการที่สร้างในวันนั้น (จำนวน / มูลค่ารวม)
+    - closed_*    : โครงการที่ปิดจบ (CLOSED) ในวันนั้น ตาม closed_at
+    - cancelled_* : โครงการที่ยกเลิกในวันนั้น ตาม closed_at
+    owner_id = 0 คือโครงการที่ไม่ระบุเจ้าของ — รายเดือน/รายปีใช้ Sum ของแถวรายวัน
+    อัปเดตอัตโนมัติเมื่อ Project / ProductItem เปลี่ยน, สร้างใหม่ทั้งหมด: python manage.py rebuild_sales_facts
+    """
+    day = models.DateField(verbose_name="วันที่")
+    job_type = models.CharField(max_length=20, verbose_name="ประเภทงาน")
+    owner_id = models.PositiveIntegerField(default=0, verbose_name="เจ้าของโครงการ")
+    created_count = models.PositiveIntegerField(default=0)
+    created_value = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    closed_count = models.PositiveIntegerField(default=0)
+    closed_value = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    cancelled_value = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "สรุปยอดขายรายวัน"
+        verbose_name_plural = "สรุปยอดขายรายวัน"
+        unique_together = ('day', 'job_type', 'owner_id')
+
+    def __str__(self):
+        return f"{self.day} {self.job_type} owner={self.owner_id}"
+
+
+class TeamDayLoad(models.Model):
+    """
+    ภาระงานของทีมต่อวัน (index) — นับจากงาน SCHEDULED / IN_PROGRESS ที่ทีมรับผิดชอบในวันนั้น
+    อัปเดตอัตโนมัติเมื่อสถานะ / วันนัด / ทีมของ ServiceQueueItem เปลี่ยน (pms/team_load.py)
+    ใช้แทนการนับ team.tasks ทีละทีมตอนแนะนำทีม และเป็นจุดเริ่ม time slot ถัดไปตอนจัดคิว
+    """
+    team = models.ForeignKey(ServiceTeam, on_delete=models.CASCADE, related_name='day_loads', verbose_name="ทีม")
+    date = models.DateField(verbose_name="วันที่")
+    task_count = models.PositiveIntegerField(default=0, verbose_name="จำนวนงาน")
+    booked_hours = models.DecimalField(max_digits=5, decimal_places=1, default=0, verbose_name="ชั่วโมงที่จองแล้ว")
+    next_slot = models.TimeField(verbose_name="เวลาว่างถัดไป")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "ภาระงานทีมรายวัน"
+        verbose_name_plural = "ภาระงานทีมรายวัน"
+        unique_together = ('team', 'date')
+
+    def __str__(self):
+        return f"{self.team.name} {self.date} ({self.task_count} งาน)"
+
+
 class TeamMessage(models.Model):
     team = models.ForeignKey(ServiceTeam, on_delete=models.CASCADE, related_name='messages', verbose_name="ทีม")
     subject = models.CharField(max_length=255, verbose_name="หัวข้อ")
@@ -1223,11 +1287,57 @@ class TechnicianGPSLog(models.Model):
         verbose_name = "GPS Log ช่าง"
         verbose_name_plural = "GPS Logs ช่าง"
         ordering = ['timestamp']
+        # รายงานทุกหน้ากรองด้วยช่วงเวลาแบบครึ่งเปิด [เที่ยงคืน, เที่ยงคืนถัดไป) (pms/gps_rollup.py) —
+        # รายคน: (user, timestamp), ทุกคนในวัน/เดือน: timestamp
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='gpslog_user_ts_idx'),
+            models.Index(fields=['timestamp'], name='gpslog_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} | {self.get_check_type_display()} | {self.timestamp.strftime('%d/%m/%Y %H:%M')}"
 
 
+class TechnicianDaySummary(models.Model):
+    """
+    สรุป GPS log ของช่างรายวัน (pms/gps_rollup.py) — รายงานรายเดือน / กราฟสถิติช่างอ่านจากตารางนี้แทน log ดิบ
+    - first_at / last_at  : เวลา log แรก / สุดท้ายของวัน
+    - *_count             : จำนวน log แต่ละประเภท
+    - work_sessions       : จำนวนงานที่เริ่ม (ON_SITE / CHECK_IN) แล้วจับคู่กับ CHECK_OUT ได้ / work_minutes เวลารวม
+    - distance_km         : ระยะทางรวมระหว่างพิกัดที่ต่อเนื่องกันของวัน
+    อัปเดตอัตโนมัติเมื่อ TechnicianGPSLog ถูกบันทึก/ลบ, สร้างใหม่ทั้งหมด: python manage.py rebuild_gps_rollup
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='gps_days', verbose_name="ช่าง")
+    day = models.DateField(verbose_name="วันที่")
+    first_at = models.DateTimeField(verbose_name="log แรก")
+    last_at = models.DateTimeField(verbose_name="log สุดท้าย")
+    log_count = models.PositiveIntegerField(default=0)
+    go_work_count = models.PositiveIntegerField(default=0)
+    on_site_count = models.PositiveIntegerField(default=0)
+    check_in_count = models.PositiveIntegerField(default=0)
+    check_out_count = models.PositiveIntegerField(default=0)
+    back_office_count = models.PositiveIntegerField(default=0)
+    travel_count = models.PositiveIntegerField(default=0)
+    work_sessions = models.PositiveIntegerField(default=0)
+    work_minutes = models.PositiveIntegerField(default=0)
+    distance_km = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name = "สรุป GPS ช่างรายวัน"
+        verbose_name_plural = "สรุป GPS ช่างรายวัน"
+        unique_together = ('user', 'day')
+        indexes = [models.Index(fields=['day'], name='gpsday_day_idx')]
+
+    def __str__(self):
+        return f"{self.user_id} {self.day} ({self.log_count} logs)"
+
+    @property
+    def ci_count(self):
+        """เริ่มงาน (ON_SITE + CHECK_IN แบบเดิม)"""
+        return self.on_site_count + self.check_in_count
+
+
 class TechnicianTrackingState(models.Model):
     """
     เก็บสถานะ Force Auto-Track ของช่างแต่ละคน
@@ -1287,10 +1397,11 @@ from django.dispatch import receiver
 
 @receiver(post_save, sender=Project)
 def auto_sync_to_queue(sender, instance, **kwargs):
-    """Automatically run sync when a project is saved/updated."""
+    """ซิงค์เฉพาะโครงการที่ถูกบันทึกเข้า AI Queue (ไม่กวาดทุกโครงการ) — ทีมแนะนำถูกเติมโดย worker เบื้องหลัง"""
     try:
-        from utils.ai_service_manager import sync_projects_to_queue
-        sync_projects_to_queue()
+        from utils.ai_service_manager import is_queue_status, sync_project_to_queue
+        if is_queue_status(instance.status):
+            sync_project_to_queue(instance)
     except Exception:
         pass
 
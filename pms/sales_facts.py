@@ -0,0 +1,144 @@
+# ====== sales_facts.py — มูลค่าโครงการแบบ denormalized + ตารางสรุปยอดขายรายวัน (ProjectSalesFact) ======
+# เดิม dashboard / owner_sales_report คำนวณ Sum(F('items__quantity') * F('items__unit_price')) โดย join
+# Project × ProductItem ทั้งตารางใหม่ทุกครั้งที่เปิดหน้า (ทุกโหมด daily / monthly / yearly + กราฟ 12 เดือน)
+#
+# โมดูลนี้:
+#   - refresh_project_value: คำนวณ Project.total_value ใหม่หลัง ProductItem ถูกบันทึก/ลบ (UPDATE เดียว)
+#   - refresh_days: คำนวณแถว ProjectSalesFact ของวันที่ระบุใหม่จาก Project (อ่าน total_value ไม่ join items)
+#     คำนวณใหม่ทั้งวันแทนการบวก/ลบทีละ event — ตารางสรุปไม่มีทางเพี้ยนสะสม
+#     ล็อกวันก่อนอ่าน และ signal เรียกหลัง commit ครั้งเดียวต่อทรานแซกชัน (utils/day_rollup.py)
+#   - project_days: วันที่ของโครงการที่มีผลต่อตารางสรุป (วันที่สร้าง + วันที่ปิด/ยกเลิก)
+#   - rebuild: คำนวณ total_value ของทุกโครงการ + สร้างตารางสรุปใหม่ทั้งหมด (python manage.py rebuild_sales_facts)
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from utils.day_rollup import lock
+
+# ไม่ระบุเจ้าของโครงการ
+NO_OWNER = 0
+
+
+def local_day(dt):
+    return timezone.localdate(dt) if timezone.is_aware(dt) else dt.date()
+
+
+def project_days(created_at, closed_at, *extra):
+    return {local_day(dt) for dt in (created_at, closed_at, *extra) if dt}
+
+
+def _value_subquery():
+    from pms.models import ProductItem
+
+    total = (
+        ProductItem.objects.filter(project=OuterRef('pk')).order_by()
+        .values('project').annotate(total=Sum(F('quantity') * F('unit_price'))).values('total')
+    )
+    return Coalesce(
+        Subquery(total, output_field=DecimalField(max_digits=15, decimal_places=2)),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def refresh_project_value(project_id):
+    """
+    คำนวณ total_value ของโครงการใหม่ทันที แล้วนัดคำนวณตารางสรุปของวันที่เกี่ยวข้องใหม่หลัง commit
+    (บันทึกรายการสินค้าหลายรายการในทรานแซกชันเดียว → คำนวณแต่ละวันครั้งเดียว)
+    """
+    from pms.models import Project
+    from utils.day_rollup import on_commit
+
+    Project.objects.filter(pk=project_id).update(total_value=_value_subquery())
+    row = Project.objects.filter(pk=project_id).values_list('created_at', 'closed_at').first()
+    if row:
+        on_commit(refresh_days, project_days(*row))
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def _aggregate(rows, days):
+    """
+    rows: (job_type, owner_id, status, total_value, created_at, closed_at) ของ Project
+    Returns: {(day, job_type, owner_id): {field: ค่า}} เฉพาะวันใน days (None = ทุกวัน)
+    """
+    from pms.models import Project
+
+    facts = defaultdict(lambda: defaultdict(Decimal))
+    for job_type, owner_id, status, value, created_at, closed_at in rows:
+        owner_id = owner_id or NO_OWNER
+        value = value or Decimal('0')
+        created_day = local_day(created_at)
+        if days is None or created_day in days:
+            fact = facts[(created_day, job_type, owner_id)]
+            fact['created_count'] += 1
+            fact['created_value'] += value
+        if closed_at and status in (Project.Status.CLOSED, Project.Status.CANCELLED):
+            closed_day = local_day(closed_at)
+            if days is None or closed_day in days:
+                prefix = 'closed' if status == Project.Status.CLOSED else 'cancelled'
+                fact = facts[(closed_day, job_type, owner_id)]
+                fact[f'{prefix}_count'] += 1
+                fact[f'{prefix}_value'] += value
+    return facts
+
+
+def _rows(queryset):
+    return queryset.values_list('job_type', 'owner_id', 'status', 'total_value', 'created_at', 'closed_at')
+
+
+def _write(facts):
+    from pms.models import ProjectSalesFact
+
+    ProjectSalesFact.objects.bulk_create(
+        [
+            ProjectSalesFact(day=day, job_type=job_type, owner_id=owner_id, **{
+                field: int(v) if field.endswith('_count') else v for field, v in values.items()
+            })
+            for (day, job_type, owner_id), values in facts.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def refresh_days(days):
+    """
+    คำนวณแถวสรุปของวันที่ระบุใหม่ทั้งหมด (โครงการที่สร้าง หรือปิด/ยกเลิก ในวันเหล่านั้น)
+    ล็อกวันก่อนอ่านโครงการ — สองทรานแซกชันที่คำนวณวันเดียวกันต่อคิวกัน ไม่ชน unique (day, job_type, owner_id)
+    """
+    from pms.models import Project, ProjectSalesFact
+
+    days = {day for day in days if day}
+    if not days:
+        return
+    in_days = Q()
+    for day in days:
+        start, end = _day_range(day)
+        in_days |= Q(created_at__gte=start, created_at__lt=end) | Q(closed_at__gte=start, closed_at__lt=end)
+
+    with transaction.atomic():
+        lock('pms_sales', days)
+        facts = _aggregate(_rows(Project.objects.filter(in_days)), days)
+        ProjectSalesFact.objects.filter(day__in=days).delete()
+        _write(facts)
+
+
+def rebuild():
+    """คำนวณ total_value ของทุกโครงการ + สร้างตารางสรุปใหม่ทั้งหมด — Returns: จำนวนแถวสรุป"""
+    from pms.models import Project, ProjectSalesFact
+
+    with transaction.atomic():
+        Project.objects.update(total_value=_value_subquery())
+        facts = _aggregate(_rows(Project.objects.all()).iterator(chunk_size=2000), None)
+        ProjectSalesFact.objects.all().delete()
+        _write(facts)
+    return len(facts)
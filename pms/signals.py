@@ -1,4 +1,4 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
 
@@ -75,3 +75,114 @@ def notify_go_work(sender, instance, created, **kwargs):
             send_telegram_message(profile.chat_id, admin_message)
         except Exception:
             pass
+
+
+# ===== TeamDayLoad: อัปเดต index ภาระงานทีมเมื่อ ServiceQueueItem เปลี่ยน =====
+
+def _refresh_item_loads(team_ids, dates):
+    from pms.team_load import refresh_team_day_loads
+    refresh_team_day_loads((team_id, date) for team_id in team_ids for date in dates if date)
+
+
+@receiver(post_save, sender='pms.ServiceQueueItem')
+def refresh_team_load_on_item_save(sender, instance, created, **kwargs):
+    """สถานะ / วันนัด / เวลา / ชั่วโมงงานเปลี่ยน → คำนวณ (ทีม, วัน) เดิมและใหม่ใหม่"""
+    from pms.team_load import LOAD_STATUSES
+
+    old = instance._old_schedule
+    new = instance.schedule_state()
+    instance._old_schedule = new
+    if created or old == new:
+        return  # งานใหม่ยังไม่มีทีม (ทีมถูกใส่ผ่าน m2m_changed)
+    if old[0] not in LOAD_STATUSES and new[0] not in LOAD_STATUSES:
+        return
+    team_ids = list(instance.assigned_teams.values_list('pk', flat=True))
+    _refresh_item_loads(team_ids, {old[1], new[1]})
+
+
+@receiver(m2m_changed, sender='pms.ServiceQueueItem_assigned_teams')
+def refresh_team_load_on_assign(sender, instance, action, reverse, pk_set, **kwargs):
+    """เพิ่ม/ถอดทีมออกจากงาน (item.assigned_teams หรือ team.tasks)"""
+    from pms.models import ServiceQueueItem
+    from pms.team_load import LOAD_STATUSES
+
+    if action == 'pre_clear':
+        # หลัง clear จะไม่รู้แล้วว่าเคยผูกกับใคร — เก็บไว้ก่อน
+        related = instance.tasks if reverse else instance.assigned_teams
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    pks = getattr(instance, '_cleared_pks', set()) if action == 'post_clear' else (pk_set or set())
+    if not pks:
+        return
+
+    if reverse:
+        # instance คือ ServiceTeam, pks คือ ServiceQueueItem
+        dates = set(
+            ServiceQueueItem.objects.filter(pk__in=pks, status__in=LOAD_STATUSES)
+            .values_list('scheduled_date', flat=True)
+        )
+        _refresh_item_loads([instance.pk], dates)
+    elif instance.status in LOAD_STATUSES:
+        _refresh_item_loads(pks, {instance.scheduled_date})
+
+
+@receiver(pre_delete, sender='pms.ServiceQueueItem')
+def remember_item_teams(sender, instance, **kwargs):
+    from pms.team_load import LOAD_STATUSES
+
+    if instance.status in LOAD_STATUSES:
+        instance._deleted_team_ids = list(instance.assigned_teams.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender='pms.ServiceQueueItem')
+def refresh_team_load_on_item_delete(sender, instance, **kwargs):
+    from pms.team_load import LOAD_STATUSES
+
+    if instance.status in LOAD_STATUSES:
+        _refresh_item_loads(getattr(instance, '_deleted_team_ids', []), {instance.scheduled_date})
+
+
+# ===== ProjectSalesFact: มูลค่าโครงการ + ตารางสรุปยอดขายรายวัน =====
+
+@receiver(post_save, sender='pms.ProductItem')
+@receiver(post_delete, sender='pms.ProductItem')
+def refresh_project_value_on_item_change(sender, instance, **kwargs):
+    """เพิ่ม/แก้/ลบรายการสินค้า → total_value ของโครงการ + แถวสรุปของวันที่สร้าง/ปิดโครงการ"""
+    from pms.sales_facts import refresh_project_value
+    refresh_project_value(instance.project_id)
+
+
+@receiver(post_save, sender='pms.Project')
+def refresh_sales_facts_on_project_save(sender, instance, **kwargs):
+    """สถานะ / เจ้าของ / ประเภทงาน / วันที่ปิดเปลี่ยน → วันที่สร้าง + วันที่ปิด (เดิมและใหม่) คำนวณใหม่หลัง commit"""
+    from pms.sales_facts import project_days, refresh_days
+    from utils.day_rollup import on_commit
+
+    on_commit(refresh_days, project_days(instance.created_at, instance.closed_at, instance._old_closed_at))
+    instance._old_closed_at = instance.closed_at
+
+
+@receiver(post_delete, sender='pms.Project')
+def refresh_sales_facts_on_project_delete(sender, instance, **kwargs):
+    from pms.sales_facts import project_days, refresh_days
+    from utils.day_rollup import on_commit
+
+    on_commit(refresh_days, project_days(instance.created_at, instance.closed_at))
+
+
+# ===== TechnicianDaySummary: สรุป GPS ช่างรายวัน =====
+
+@receiver(post_save, sender='pms.TechnicianGPSLog')
+@receiver(post_delete, sender='pms.TechnicianGPSLog')
+def refresh_gps_rollup_on_log_change(sender, instance, **kwargs):
+    """
+    log เข้า (จากแชท / หน้า GPS) หรือถูกลบ → คำนวณแถวสรุปของช่างคนนั้นในวันนั้นใหม่หลัง commit
+    log หลายจุดในทรานแซกชันเดียว (เช่น write-behind ของแชท) รวมเป็นการคำนวณครั้งเดียวต่อ (ช่าง, วัน)
+    """
+    from pms.gps_rollup import local_day, refresh_days
+    from utils.day_rollup import on_commit
+
+    if instance.timestamp:
+        on_commit(refresh_days, {(instance.user_id, local_day(instance.timestamp))})
@@ -0,0 +1,137 @@
+# ====== team_load.py — index ภาระงานของทีมต่อวัน (TeamDayLoad) ======
+# เดิม _fallback_suggest_team นับ team.tasks.filter(SCHEDULED/IN_PROGRESS).count() ทีละทีมทุกครั้งที่แนะนำทีม
+# และ schedule_queue_items เริ่มนับ time slot จาก 08:30 ใหม่ทุกรอบ (ไม่รู้ว่าวันนั้นทีมมีงานจองไว้แล้ว)
+#
+# โมดูลนี้:
+#   - refresh_team_day_loads: คำนวณแถว (ทีม, วัน) ที่ได้รับผลกระทบใหม่จาก DB แล้ว upsert ลง TeamDayLoad
+#     (เรียกจาก signal ของ ServiceQueueItem ใน pms/signals.py และหลัง bulk_update ตอนจัดคิว)
+#   - team_loads: ภาระงานรวมของหลายทีม (index + งานที่ยังไม่มีวันนัด) ใน 2 query
+#   - day_slots: เวลาว่างถัดไปของแต่ละ (ทีม, วัน) ใน query เดียว
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+
+# งานที่นับเป็นภาระของทีม
+LOAD_STATUSES = ['SCHEDULED', 'IN_PROGRESS']
+# slot แรกของทุกทีมทุกวัน
+DAY_START = datetime.time(8, 30)
+# ประมาณการชั่วโมงทำงานตามประเภทงาน — REPAIR=2h, INSTALLATION=3h, DELIVERY=1.5h, อื่นๆ=1h
+EST_HOURS = {'REPAIR': 2.0, 'INSTALLATION': 3.0, 'DELIVERY': 1.5, 'OTHER': 1.0}
+_LAST_MINUTE = 23 * 60 + 59
+
+
+def estimated_hours(task_type):
+    return EST_HOURS.get(task_type, 1.0)
+
+
+def to_minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def to_time(minutes):
+    """นาทีนับจากเที่ยงคืน → time (งานล้นเกินวันจะถูกตรึงไว้ที่ 23:59)"""
+    minutes = min(int(minutes), _LAST_MINUTE)
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def refresh_team_day_loads(keys):
+    """
+    คำนวณ TeamDayLoad ของ (team_id, date) ที่ระบุใหม่จากงานจริงใน DB (query เดียว + upsert เดียว)
+    คำนวณใหม่จากต้นทางแทนการบวก/ลบทีละ event — index ไม่มีทางเพี้ยนสะสม
+    """
+    from pms.models import ServiceQueueItem, TeamDayLoad
+
+    keys = {(team_id, date) for team_id, date in keys if team_id and date}
+    if not keys:
+        return
+
+    team_ids = {team_id for team_id, _ in keys}
+    dates = {date for _, date in keys}
+    rows = (
+        ServiceQueueItem.assigned_teams.through.objects
+        .filter(
+            serviceteam_id__in=team_ids,
+            servicequeueitem__scheduled_date__in=dates,
+            servicequeueitem__status__in=LOAD_STATUSES,
+        )
+        .values_list(
+            'serviceteam_id', 'servicequeueitem__scheduled_date',
+            'servicequeueitem__scheduled_time', 'servicequeueitem__estimated_hours',
+        )
+    )
+
+    count = defaultdict(int)
+    hours = defaultdict(Decimal)
+    slot_end = defaultdict(lambda: to_minutes(DAY_START))
+    untimed = defaultdict(int)
+    for team_id, date, start, est in rows:
+        key = (team_id, date)
+        if key not in keys:
+            continue
+        est = est or Decimal('0')
+        count[key] += 1
+        hours[key] += est
+        mins = int(est * 60)
+        if start:
+            slot_end[key] = max(slot_end[key], to_minutes(start) + mins)
+        else:
+            # งานที่ยังไม่มีเวลาเริ่ม ถือว่าต่อท้ายงานที่มีเวลาแล้ว
+            untimed[key] += mins
+
+    TeamDayLoad.objects.bulk_create(
+        [
+            TeamDayLoad(
+                team_id=team_id, date=date, task_count=count[(team_id, date)],
+                booked_hours=hours[(team_id, date)],
+                next_slot=to_time(slot_end[(team_id, date)] + untimed[(team_id, date)]),
+            )
+            for team_id, date in keys
+        ],
+        update_conflicts=True,
+        unique_fields=['team', 'date'],
+        update_fields=['task_count', 'booked_hours', 'next_slot', 'updated_at'],
+    )
+
+
+def team_loads(team_ids):
+    """
+    {team_id: จำนวนงาน SCHEDULED / IN_PROGRESS ทั้งหมดของทีม} (ทีมที่ไม่มีงาน = 0)
+    งานที่มีวันนัดอ่านจาก TeamDayLoad — งานที่ยังไม่มีวันนัดไม่อยู่ใน index จึงนับเพิ่มด้วย aggregate เดียว
+    """
+    from pms.models import ServiceQueueItem, TeamDayLoad
+
+    totals = dict(
+        TeamDayLoad.objects.filter(team_id__in=team_ids)
+        .values('team_id').annotate(total=Sum('task_count')).values_list('team_id', 'total')
+    )
+    undated = dict(
+        ServiceQueueItem.assigned_teams.through.objects
+        .filter(
+            serviceteam_id__in=team_ids,
+            servicequeueitem__scheduled_date__isnull=True,
+            servicequeueitem__status__in=LOAD_STATUSES,
+        )
+        .values('serviceteam_id').annotate(total=Count('pk')).values_list('serviceteam_id', 'total')
+    )
+    return {team_id: (totals.get(team_id) or 0) + undated.get(team_id, 0) for team_id in team_ids}
+
+
+def day_slots(keys):
+    """{(team_id, date): นาทีของเวลาว่างถัดไป} — วันที่ยังไม่มีงานเริ่มที่ DAY_START"""
+    from pms.models import TeamDayLoad
+
+    keys = set(keys)
+    slots = {key: to_minutes(DAY_START) for key in keys}
+    if not keys:
+        return slots
+    rows = TeamDayLoad.objects.filter(
+        team_id__in={team_id for team_id, _ in keys},
+        date__in={date for _, date in keys},
+    ).values_list('team_id', 'date', 'next_slot')
+    for team_id, date, next_slot in rows:
+        if (team_id, date) in keys:
+            slots[(team_id, date)] = to_minutes(next_slot)
+    return slots
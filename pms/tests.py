@@ -1,3 +1,30 @@
+import datetime
+
 from django.test import TestCase
 
-# Create your tests here.
+from .models import ServiceQueueItem, ServiceTeam
+from .team_load import LOAD_STATUSES, team_loads
+
+
+class TeamLoadTest(TestCase):
+    """ภาระงานของทีมต้องเท่ากับการนับงาน SCHEDULED / IN_PROGRESS ทั้งหมดแบบเดิม รวมงานที่ยังไม่มีวันนัด"""
+
+    def _task(self, team, status, scheduled_date=None):
+        task = ServiceQueueItem.objects.create(title='งาน', status=status, scheduled_date=scheduled_date)
+        task.assigned_teams.add(team)
+        return task
+
+    def test_undated_scheduled_tasks_count(self):
+        busy = ServiceTeam.objects.create(name='ทีม A')
+        idle = ServiceTeam.objects.create(name='ทีม B')
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        self._task(busy, 'SCHEDULED', tomorrow)
+        self._task(busy, 'IN_PROGRESS', tomorrow)
+        self._task(busy, 'SCHEDULED')  # ยังไม่มีวันนัด — ไม่มีแถวใน TeamDayLoad
+        self._task(busy, 'PENDING')
+        self._task(idle, 'COMPLETED', tomorrow)
+
+        with self.assertNumQueries(2):
+            loads = team_loads([busy.pk, idle.pk])
+        self.assertEqual(loads, {busy.pk: 3, idle.pk: 0})
+        self.assertEqual(loads[busy.pk], busy.tasks.filter(status__in=LOAD_STATUSES).count())
@@ -23,7 +23,9 @@ urlpatterns = [
     # ===== หน้าแรก & โครงการ (Dashboard & Projects) =====
     path('', views.dashboard, name='dashboard'),                                          # แดชบอร์ดหลัก
     path('projects/', views.project_list, name='project_list'),                          # รายการงานที่ดำเนินการ
+    path('projects/data/', views.project_list_data, name='project_list_data'),           # หน้าถัดไปของรายการงาน (JSON)
     path('history/', views.history_list, name='history_list'),                           # ประวัติงานที่ปิดจบ/ยกเลิก
+    path('history/data/', views.history_list_data, name='history_list_data'),            # หน้าถัดไปของประวัติงาน (JSON)
     path('create/', views.project_create, name='project_create'),                        # สร้างโครงการใหม่
     path('<int:pk>/', views.project_detail, name='project_detail'),                      # รายละเอียดโครงการ
     path('<int:pk>/edit/', views.project_update, name='project_update'),                 # แก้ไขโครงการ
@@ -164,6 +166,7 @@ urlpatterns = [
     # ── Work Summary Report + AI Analysis ─────────────────────────────────
     path('work-summary/', views.work_summary_report, name='work_summary_report'),              # รายงานสรุปการทำงาน
     path('work-summary/ai/', views.work_summary_ai_analysis, name='work_summary_ai_analysis'), # AI วิเคราะห์ประสิทธิภาพ
+    path('work-summary/ai/stream/', views.work_summary_ai_stream, name='work_summary_ai_stream'), # AI วิเคราะห์ประสิทธิภาพ (SSE)
     path('installation-report/', views.installation_report, name='installation_report'),        # รายงานมูลค่าและเวลาติดตั้ง
     path('installation-report/send-to-chat/', views.installation_report_send_to_chat, name='installation_report_send_to_chat'),
     path('owner-sales-report/', views.owner_sales_report, name='owner_sales_report'),
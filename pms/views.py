@@ -18,7 +18,7 @@ from .models import (
     CustomerRequirement, ProjectFile, CustomerRequest,
     ServiceQueueItem, SLAPlan, JobStatus, ProjectStatusAssignment,
     UserNotification, ProjectStatusLog, RequestStatusLog, Skill, Lead,
-    ProjectEstimation
+    ProjectEstimation, ProjectSalesFact
 )
 from .forms import (
     ProjectForm, ProductItemForm, CustomerForm, SupplierForm, 
@@ -252,16 +252,9 @@ def _check_project_lock(project, request):
             return True
     return False
 
-# รายการงานทั้งหมดที่ยังอยู่ในสถานะที่เจ้าหน้าที่ต้องดำเนินการ (Active)
-# โดยระบบจะกรองเฉพาะงานที่ยังไม่ถูก 'ปิดจบ' หรือ 'ยกเลิก' ออกมาแสดงผล
-@login_required
-def project_list(request):
-    # Default: Show active projects (Exclude CLOSED and CANCELLED)
-    projects = Project.objects.exclude(
-        status__in=[Project.Status.CLOSED, Project.Status.CANCELLED]
-    )
-
-    # Build status choices dynamically from JobStatus table so admin-added steps appear automatically.
+# สถานะที่ใช้ในหน้ารายการงาน (ไม่รวม CLOSED / CANCELLED) เรียงตาม sort_order ของ JobStatus
+# ดึงจากตาราง JobStatus เพื่อให้ขั้นตอนที่ admin เพิ่มเองแสดงอัตโนมัติ
+def _active_status_choices():
     _js_rows = (
         JobStatus.objects
         .filter(is_active=True)
@@ -283,44 +276,47 @@ def project_list(request):
         if _row['status_key'] not in _seen_statuses:
             _seen_statuses[_row['status_key']] = (_row['label'], _row['sort_order'])
 
-    status_choices = [
+    return [
         (k, v[0])
         for k, v in sorted(_seen_statuses.items(), key=lambda x: (x[1][1], x[0]))
     ]
 
-    # Handle Sorting
-    sort_by = request.GET.get('sort', '-date')
-    
+
+# ตัวกรอง + คีย์การเรียงของหน้ารายการงาน (ใช้ร่วมกันระหว่างหน้าแรกและ endpoint infinite scroll)
+# Returns: (queryset ที่มี annotation sort_key, sort_by, เรียงจากมากไปน้อยหรือไม่)
+def _project_list_queryset(request, status_choices):
+    from django.db.models.functions import Coalesce
+
+    projects = Project.objects.exclude(
+        status__in=[Project.Status.CLOSED, Project.Status.CANCELLED]
+    ).select_related('customer', 'owner')
+
     # Annotation for logical status priority
     status_priority_cases = []
     for i, (k, v) in enumerate(status_choices):
         status_priority_cases.append(When(status=k, then=Value(i)))
-    
-    projects = projects.annotate(
-        status_priority=Case(
-            *status_priority_cases,
-            default=Value(999),
-            output_field=IntegerField()
-        ),
-        val=Sum(F('items__quantity') * F('items__unit_price'))
+    status_priority = Case(
+        *status_priority_cases,
+        default=Value(999),
+        output_field=IntegerField()
     )
 
+    # Handle Sorting — ทุกคีย์ต้องไม่เป็น NULL (keyset pagination เทียบค่าด้วย < / >)
+    sort_by = request.GET.get('sort', '-date')
     sort_map = {
-        'name': 'name',
-        'customer': 'customer__name',
-        'owner': 'owner__name',
-        'status': 'status_priority',
-        'value': 'val',
-        'date': 'created_at',
-        '-name': '-name',
-        '-customer': '-customer__name',
-        '-owner': '-owner__name',
-        '-status': '-status_priority',
-        '-value': '-val',
-        '-date': '-created_at',
+        'name': F('name'),
+        'customer': F('customer__name'),
+        'owner': Coalesce(F('owner__name'), Value('')),
+        'status': status_priority,
+        'value': F('total_value'),
+        'date': F('created_at'),
     }
-    actual_sort = sort_map.get(sort_by, '-created_at')
-    projects = projects.order_by(actual_sort)
+    if sort_by.lstrip('-') not in sort_map:
+        sort_by = '-date'
+    projects = projects.annotate(
+        val=F('total_value'),
+        sort_key=sort_map[sort_by.lstrip('-')],
+    )
 
     # Filter
     status_filter = request.GET.get('status')
@@ -344,42 +340,130 @@ def project_list(request):
     if date_from and date_to:
         projects = projects.filter(created_at__date__range=[date_from, date_to])
 
+    return projects, sort_by, sort_by.startswith('-')
+
+
+# ป้ายสถานะของทุก (ประเภทงาน, สถานะ) จาก JobStatus ใน query เดียว
+# แทน project.get_job_status_display() ที่ query ตาราง JobStatus ทีละแถว
+def _attach_status_labels(projects):
+    labels = dict(
+        ((job_type, key), label)
+        for job_type, key, label in JobStatus.objects.filter(is_active=True)
+        .values_list('job_type', 'status_key', 'label')
+    )
+    for p in projects:
+        p.status_label = labels.get((p.job_type, p.status)) or p.get_job_status_display
+    return projects
+
+
+# แปลงโครงการเป็น dict ขนาดเล็กสำหรับ infinite scroll (วันที่จัดรูปแบบแบบเดียวกับ template)
+def _project_row(p):
+    from django.urls import reverse
+    from django.utils.formats import date_format
+
+    def _fmt(dt, fmt):
+        if not dt:
+            return ''
+        if isinstance(dt, datetime):
+            dt = timezone.localtime(dt)
+        return date_format(dt, fmt)
+
+    return {
+        'id': p.pk,
+        'url': reverse('pms:project_detail', args=[p.pk]),
+        'name': p.name,
+        'job_type': p.job_type,
+        'job_type_label': p.get_job_type_display(),
+        'status': p.status,
+        'status_label': getattr(p, 'status_label', ''),
+        'customer': p.customer.name,
+        'owner': p.owner.name if p.owner else '',
+        'value': float(p.val or 0),
+        'deadline': _fmt(p.deadline, 'd M Y'),
+        'created': _fmt(p.created_at, 'd M Y'),
+        'closed': _fmt(p.closed_at, 'd M Y'),
+        'closed_time': _fmt(p.closed_at, 'H:i'),
+    }
+
+
+# รายการงานทั้งหมดที่ยังอยู่ในสถานะที่เจ้าหน้าที่ต้องดำเนินการ (Active)
+# โดยระบบจะกรองเฉพาะงานที่ยังไม่ถูก 'ปิดจบ' หรือ 'ยกเลิก' ออกมาแสดงผล
+# render เฉพาะหน้าแรก — หน้าถัดไปโหลดผ่าน project_list_data (keyset pagination)
+@login_required
+def project_list(request):
+    from .keyset import paginate
+
+    status_choices = _active_status_choices()
+    projects, sort_by, descending = _project_list_queryset(request, status_choices)
+    projects, next_cursor = paginate(projects, sort_by, descending)
+    _attach_status_labels(projects)
+
+    customer_filter = request.GET.get('customer')
+    selected_customer = (
+        Customer.objects.filter(pk=customer_filter).only('id', 'name').first()
+        if customer_filter and customer_filter.isdigit() else None
+    )
+
     context = {
         'projects': projects,
+        'next_cursor': next_cursor,
         'status_choices': status_choices,
         'project_owners': ProjectOwner.objects.all(),
-        'customers': Customer.objects.all().only('id', 'name'),
+        'selected_customer': selected_customer,
         'title': 'รายการงานที่กำลังดำเนินการ',
         'sort_by': sort_by,
         'next_sort_name': '-name' if sort_by == 'name' else 'name',
         'next_sort_customer': '-customer' if sort_by == 'customer' else 'customer',
         'next_sort_owner': '-owner' if sort_by == 'owner' else 'owner',
-        'next_sort_status': '-status' if sort_by == 'status' or sort_by == 'status_priority' else 'status',
+        'next_sort_status': '-status' if sort_by == 'status' else 'status',
         'next_sort_value': 'value' if sort_by == '-value' else '-value',
         'next_sort_date': 'date' if sort_by == '-date' else '-date',
     }
     return render(request, 'pms/project_list.html', context)
 
-# ประวัติงานที่ปิดจบหรือยกเลิกแล้ว — เรียงจากล่าสุดขึ้นก่อน รองรับค้นหาและกรองประเภทงาน
+
+# AJAX endpoint: หน้าถัดไปของรายการงาน (infinite scroll) — ใช้ตัวกรอง/การเรียงเดียวกับ project_list + ?cursor=
 @login_required
-def history_list(request):
-    """
-    แสดงงานที่จบแล้ว (CLOSED/CANCELLED) 
-    ค่าเริ่มต้น: ไม่แสดงงานมูลค่า 0 และไม่แสดงงานยกเลิก (ต้องเลือกใน Filter)
-    """
+def project_list_data(request):
+    from .keyset import paginate
+
+    projects, sort_by, descending = _project_list_queryset(request, _active_status_choices())
+    projects, next_cursor = paginate(projects, sort_by, descending, request.GET.get('cursor'))
+    _attach_status_labels(projects)
+    return JsonResponse({'results': [_project_row(p) for p in projects], 'next': next_cursor})
+
+
+# ตัวกรอง + คีย์การเรียงของหน้าประวัติงาน (ใช้ร่วมกันระหว่างหน้าแรกและ endpoint infinite scroll)
+def _history_list_queryset(request):
+    from django.db.models.functions import Coalesce
+
     # 1. Search & Filters
     search_q = request.GET.get('q', '')
     jt_filter = request.GET.get('job_type', '')
     show_zero = request.GET.get('show_zero') == 'on'
     show_cancelled = request.GET.get('show_cancelled') == 'on'
-    sort_by = request.GET.get('sort', '-closed_at')
+    sort_by = request.GET.get('sort', '-date')
+    if sort_by in ('closed_at', '-closed_at'):
+        sort_by = sort_by.replace('closed_at', 'date')
 
-    # 2. Base Query with Annotation
-    projects = Project.objects.annotate(
-        val=Sum(F('items__quantity') * F('items__unit_price'))
+    # 2. Sorting — งานเก่าที่ไม่มี closed_at ใช้ created_at แทน (keyset ต้องไม่มีค่า NULL)
+    sort_map = {
+        'name': F('name'),
+        'customer': F('customer__name'),
+        'status': F('status'),
+        'value': F('total_value'),
+        'date': Coalesce(F('closed_at'), F('created_at')),
+    }
+    if sort_by.lstrip('-') not in sort_map:
+        sort_by = '-date'
+
+    # 3. Base Query with Annotation
+    projects = Project.objects.select_related('customer', 'owner').annotate(
+        val=F('total_value'),
+        sort_key=sort_map[sort_by.lstrip('-')],
     ).filter(status__in=[Project.Status.CLOSED, Project.Status.CANCELLED])
 
-    # 3. Applying Filters
+    # 4. Applying Filters
     if not show_zero:
         projects = projects.filter(val__gt=0)
     
@@ -396,38 +480,52 @@ def history_list(request):
     if jt_filter:
         projects = projects.filter(job_type=jt_filter)
 
-    # 4. Sorting logic
-    sort_map = {
-        'name': 'name',
-        'customer': 'customer__name',
-        'status': 'status',
-        'value': 'val',
-        'date': 'closed_at',
-        '-name': '-name',
-        '-customer': '-customer__name',
-        '-status': '-status',
-        '-value': '-val',
-        '-date': '-closed_at',
+    filters = {
+        'search_q': search_q,
+        'jt_filter': jt_filter,
+        'show_zero': show_zero,
+        'show_cancelled': show_cancelled,
     }
-    actual_sort = sort_map.get(sort_by, '-closed_at')
-    projects = projects.order_by(actual_sort)
+    return projects, sort_by, sort_by.startswith('-'), filters
+
+
+# ประวัติงานที่ปิดจบหรือยกเลิกแล้ว — เรียงจากล่าสุดขึ้นก่อน รองรับค้นหาและกรองประเภทงาน
+@login_required
+def history_list(request):
+    """
+    แสดงงานที่จบแล้ว (CLOSED/CANCELLED) 
+    ค่าเริ่มต้น: ไม่แสดงงานมูลค่า 0 และไม่แสดงงานยกเลิก (ต้องเลือกใน Filter)
+    render เฉพาะหน้าแรก — หน้าถัดไปโหลดผ่าน history_list_data (keyset pagination)
+    """
+    from .keyset import paginate
+
+    projects, sort_by, descending, filters = _history_list_queryset(request)
+    projects, next_cursor = paginate(projects, sort_by, descending)
 
     context = {
         'projects': projects,
+        'next_cursor': next_cursor,
         'title': 'ประวัติงานทั้งหมด (ปิดงาน/ยกเลิก)',
         'job_types': Project.JobType.choices,
-        'search_q': search_q,
-        'jt_filter': jt_filter,
-        'show_zero': show_zero,
-        'show_cancelled': show_cancelled,
+        **filters,
         'sort_by': sort_by,
         'next_sort_name': '-name' if sort_by == 'name' else 'name',
         'next_sort_customer': '-customer' if sort_by == 'customer' else 'customer',
         'next_sort_value': 'value' if sort_by == '-value' else '-value',
-        'next_sort_date': 'date' if sort_by == '-date' or sort_by == '-closed_at' else '-date',
+        'next_sort_date': 'date' if sort_by == '-date' else '-date',
     }
     return render(request, 'pms/history_list.html', context)
 
+
+# AJAX endpoint: หน้าถัดไปของประวัติงาน (infinite scroll) — ใช้ตัวกรอง/การเรียงเดียวกับ history_list + ?cursor=
+@login_required
+def history_list_data(request):
+    from .keyset import paginate
+
+    projects, sort_by, descending, _ = _history_list_queryset(request)
+    projects, next_cursor = paginate(projects, sort_by, descending, request.GET.get('cursor'))
+    return JsonResponse({'results': [_project_row(p) for p in projects], 'next': next_cursor})
+
 # แสดงรายละเอียดทั้งหมดของโครงการ รายการค่าใช้จ่าย ประวัติการทำงาน และไฟล์แนบ
 # รวมถึงหน้าจอสำหรับอัปเดตสถานะโครงการในรูปแบบขั้นตอนแบบ Step-by-Step
 @login_required
@@ -1160,8 +1258,9 @@ def project_estimation(request, pk):
 @login_required
 def dashboard(request):
     from django.db import models
-    from django.db.models import Sum, Count, F, Q, Case, When, Value
+    from django.db.models import Sum, F, Q, Case, When, Value
     from django.db.models.functions import TruncMonth
+    from collections import defaultdict
     import json
     from datetime import datetime, timedelta
     from django.utils import timezone
@@ -1235,8 +1334,6 @@ def dashboard(request):
         start_of_period = timezone.make_aware(datetime(year_filter, month_filter, 1))
         end_of_period = timezone.make_aware(datetime(year_filter, month_filter, last_day, 23, 59, 59))
 
-    projects_in_period = Project.objects.filter(created_at__range=[start_of_period, end_of_period])
-
     # 1. Total Accumulated Backlog (งานสะสม)
     # As requested: "งานสะสม คืองานที่มีสถานะทุกสถานะ ยกเว้น สถานะปิดจบ และยกเลิก"
     all_projects = Project.objects.all()
@@ -1257,39 +1354,42 @@ def dashboard(request):
     
     active_projects = all_projects.exclude(p_exclude).count()
     
+    # มูลค่างาน / ยอดขาย / ยกเลิก ของช่วงที่เลือก — อ่านจากตารางสรุปรายวัน ProjectSalesFact (pms/sales_facts.py)
+    # แทนการ join Project × ProductItem ทั้งตารางทุกครั้งที่เปิดหน้า
+    fact_sums = dict(
+        created_value=Sum('created_value'),
+        closed_count=Sum('closed_count'), closed_value=Sum('closed_value'),
+        cancelled_count=Sum('cancelled_count'), cancelled_value=Sum('cancelled_value'),
+        created_count=Sum('created_count'),
+    )
+    period_facts = list(
+        ProjectSalesFact.objects.filter(
+            day__range=[timezone.localdate(start_of_period), timezone.localdate(end_of_period)]
+        ).values('job_type').annotate(**fact_sums)
+    )
+
     # ยอดรวมของงาน (Total Job Value) - PMS Projects only in period
-    total_job_value = projects_in_period.aggregate(
-        total=Sum(F('items__quantity') * F('items__unit_price'))
-    )['total'] or 0
+    total_job_value = sum(f['created_value'] or 0 for f in period_facts)
     
     # ยอดขาย (Actual Sales) - PMS Projects closed in period only
-    actual_sales = Project.objects.filter(
-        status=Project.Status.CLOSED,
-        closed_at__range=[start_of_period, end_of_period]
-    ).aggregate(
-        total=Sum(F('items__quantity') * F('items__unit_price'))
-    )['total'] or 0
+    actual_sales = sum(f['closed_value'] or 0 for f in period_facts)
  
     # Cancelled PMS Projects in period
-    cancelled_count = all_projects.filter(
-        status=Project.Status.CANCELLED,
-        closed_at__range=[start_of_period, end_of_period]
-    ).count()
-    
-    cancelled_value = all_projects.filter(
-        status=Project.Status.CANCELLED,
-        closed_at__range=[start_of_period, end_of_period]
-    ).aggregate(total=Sum(F('items__quantity') * F('items__unit_price')))['total'] or 0
+    cancelled_count = sum(f['cancelled_count'] or 0 for f in period_facts)
+    cancelled_value = sum(f['cancelled_value'] or 0 for f in period_facts)
 
     # 2. Sales by Month (Full Year: Jan to Dec of selected year)
     start_of_year = timezone.make_aware(datetime(year_filter, 1, 1))
     end_of_year = timezone.make_aware(datetime(year_filter, 12, 31, 23, 59, 59))
     
-    monthly_sales_qs = Project.objects.filter(created_at__range=[start_of_year, end_of_year])\
-        .annotate(month=TruncMonth('created_at'))\
-        .values('month', 'job_type', 'owner__name')\
-        .annotate(revenue=Sum(F('items__quantity') * F('items__unit_price')))\
+    year_facts = list(
+        ProjectSalesFact.objects.filter(day__range=[start_of_year.date(), end_of_year.date()])
+        .annotate(month=TruncMonth('day'))
+        .values('month', 'job_type', 'owner_id')
+        .annotate(**fact_sums)
         .order_by('month')
+    )
+    owner_name_map = dict(ProjectOwner.objects.values_list('id', 'name'))
 
     # Prepare data for Line Chart (Full 12 Months)
     months_labels = ['ม.ค.', 'ก.พ.', 'มี.ค.', 'เม.ย.', 'พ.ค.', 'มิ.ย.', 'ก.ค.', 'ส.ค.', 'ก.ย.', 'ต.ค.', 'พ.ย.', 'ธ.ค.']
@@ -1301,44 +1401,28 @@ def dashboard(request):
     owner_trends = {} # { 'Owner Name': [0]*12 }
     
     # --- 2.2 Completion and Value Analysis ---
+    # TOTAL = สร้างในเดือนนั้น (created_at), CLOSED = ปิดจบในเดือนนั้น (closed_at)
     completion_closed_series = [0] * 12
     completion_total_series = [0] * 12
     completion_closed_value = [0] * 12
     completion_total_value = [0] * 12
 
-    # Query for 'TOTAL' (Created): PMS Projects
-    total_projects_qs = Project.objects.filter(created_at__range=[start_of_year, end_of_year])\
-        .annotate(month=TruncMonth('created_at'))\
-        .values('month')\
-        .annotate(
-            count=Count('id'),
-            value=Sum(F('items__quantity') * F('items__unit_price'))
-        )
-    for entry in total_projects_qs:
-        m_index = entry['month'].month - 1
-        completion_total_series[m_index] += entry['count']
-        completion_total_value[m_index] += float(entry['value'] or 0)
-
-    # Query for 'CLOSED' (Finished): PMS Projects only (Using closed_at)
-    closed_projects_qs = Project.objects.filter(
-        status=Project.Status.CLOSED,
-        closed_at__range=[start_of_year, end_of_year]
-    ).annotate(month=TruncMonth('closed_at'))\
-     .values('month')\
-     .annotate(
-         count=Count('id'),
-         value=Sum(F('items__quantity') * F('items__unit_price'))
-     )
-    for entry in closed_projects_qs:
-        m_index = entry['month'].month - 1
-        completion_closed_series[m_index] += entry['count']
-        completion_closed_value[m_index] += float(entry['value'] or 0)
+    # ยอดปิดจบทั้งปีแยกตามเจ้าของ (สำหรับ sales_by_owner)
+    owner_closed = defaultdict(lambda: {'value': Decimal('0'), 'count': 0})
 
-    for entry in monthly_sales_qs:
+    for entry in year_facts:
         m_index = entry['month'].month - 1
         jt = entry['job_type']
-        owner_name = entry['owner__name'] or 'ไม่ระบุ'
-        rev = float(entry['revenue'] or 0)
+        owner_name = owner_name_map.get(entry['owner_id']) or 'ไม่ระบุ'
+        rev = float(entry['created_value'] or 0)
+
+        completion_total_series[m_index] += entry['created_count'] or 0
+        completion_total_value[m_index] += rev
+        completion_closed_series[m_index] += entry['closed_count'] or 0
+        completion_closed_value[m_index] += float(entry['closed_value'] or 0)
+        if entry['owner_id'] in owner_name_map:
+            owner_closed[entry['owner_id']]['value'] += entry['closed_value'] or 0
+            owner_closed[entry['owner_id']]['count'] += entry['closed_count'] or 0
         
         # Trend by Type
         if jt == 'PROJECT':
@@ -1370,27 +1454,13 @@ def dashboard(request):
                 'borderWidth': 3
             })
 
-    sales_by_owner = ProjectOwner.objects.annotate(
-        total_sales=Sum(
-            Case(
-                When(
-                    projects__status=Project.Status.CLOSED,
-                    projects__closed_at__range=[start_of_year, end_of_year], 
-                    then=F('projects__items__quantity') * F('projects__items__unit_price')
-                ),
-                default=0,
-                output_field=DecimalField(max_digits=15, decimal_places=2)
-            )
-        ),
-        job_count=Count(
-            'projects',
-            filter=Q(
-                projects__status=Project.Status.CLOSED,
-                projects__closed_at__range=[start_of_year, end_of_year]
-            ),
-            distinct=True
-        )
-    ).filter(total_sales__gt=0).order_by('-total_sales')
+    sales_by_owner = list(ProjectOwner.objects.filter(pk__in=[
+        owner_id for owner_id, closed in owner_closed.items() if closed['value'] > 0
+    ]))
+    for owner in sales_by_owner:
+        owner.total_sales = owner_closed[owner.pk]['value']
+        owner.job_count = owner_closed[owner.pk]['count']
+    sales_by_owner.sort(key=lambda o: o.total_sales, reverse=True)
 
     owner_names = [o.name for o in sales_by_owner if o.total_sales and o.total_sales > 0]
     owner_sales = [float(o.total_sales or 0) for o in sales_by_owner if o.total_sales and o.total_sales > 0]
@@ -1403,14 +1473,10 @@ def dashboard(request):
         'REPAIR': {'label': 'งานแจ้งซ่อม', 'value': 0},
     }
     
-    type_dist_qs = projects_in_period.values('job_type').annotate(
-        value=Sum(F('items__quantity') * F('items__unit_price'))
-    )
-    
-    for d in type_dist_qs:
+    for d in period_facts:
         jt = d['job_type']
         if jt in type_map:
-            type_map[jt]['value'] = float(d['value'] or 0)
+            type_map[jt]['value'] = float(d['created_value'] or 0)
 
     type_labels = [type_map['PROJECT']['label'], type_map['SERVICE']['label'], type_map['REPAIR']['label']]
     type_values = [type_map['PROJECT']['value'], type_map['SERVICE']['value'], type_map['REPAIR']['value']]
@@ -1425,7 +1491,7 @@ def dashboard(request):
             Case(
                 When(projects__status=Project.Status.CLOSED,
                      projects__closed_at__range=[start_of_period, end_of_period],
-                     then=F('projects__items__quantity') * F('projects__items__unit_price')),
+                     then=F('projects__total_value')),
                 default=Value(0),
                 output_field=DecimalField(max_digits=15, decimal_places=2)
             )
@@ -2239,6 +2305,8 @@ def send_queue_notifications(request):
                         f'chat_{pms_room.id}',
                         {
                             'type': 'chat_message',
+                            'id': chat_msg.id,
+                            'seq': chat_msg.seq,
                             'message': full_content,
                             'username': request.user.username,
                             'user_id': request.user.id,
@@ -2773,26 +2841,26 @@ def ai_dashboard_analysis(request):
     end_of_period = timezone.make_aware(datetime(year_filter, month_filter, last_day, 23, 59, 59))
 
     projects_in_period = Project.objects.filter(created_at__range=[start_of_period, end_of_period])
-    total_revenue = projects_in_period.aggregate(total=Sum(F('items__quantity') * F('items__unit_price')))['total'] or 0
+    total_revenue = projects_in_period.aggregate(total=Sum('total_value'))['total'] or 0
     total_count = projects_in_period.count()
     
     # Sales by Type
-    type_stats = projects_in_period.values('job_type').annotate(revenue=Sum(F('items__quantity') * F('items__unit_price')))
+    type_stats = projects_in_period.values('job_type').annotate(revenue=Sum('total_value'))
     type_summary = ", ".join([f"{t['job_type']}: ฿{t['revenue'] or 0:,.2f}" for t in type_stats])
 
     # Sales by Owner
     owner_stats = ProjectOwner.objects.annotate(
-        total_sales=Sum(Case(When(projects__created_at__range=[start_of_period, end_of_period], then=F('projects__items__quantity') * F('projects__items__unit_price')), default=0, output_field=DecimalField(max_digits=15, decimal_places=2)))
+        total_sales=Sum(Case(When(projects__created_at__range=[start_of_period, end_of_period], then=F('projects__total_value')), default=0, output_field=DecimalField(max_digits=15, decimal_places=2)))
     ).filter(total_sales__gt=0).order_by('-total_sales')
     owner_summary = ", ".join([f"{o.name}: ฿{o.total_sales:,.2f}" for o in owner_stats])
 
     # Calculate actual sales (closed jobs) for AI context - PMS Projects only
-    actual_sales = Project.objects.filter(status=Project.Status.CLOSED, closed_at__range=[start_of_period, end_of_period]).aggregate(total=Sum(F('items__quantity') * F('items__unit_price')))['total'] or 0
+    actual_sales = Project.objects.filter(status=Project.Status.CLOSED, closed_at__range=[start_of_period, end_of_period]).aggregate(total=Sum('total_value'))['total'] or 0
 
     # Cancelled Stats for AI
     cancelled_projects = Project.objects.filter(status=Project.Status.CANCELLED, closed_at__range=[start_of_period, end_of_period])
     cancelled_count = cancelled_projects.count()
-    cancelled_value = cancelled_projects.aggregate(total=Sum(F('items__quantity') * F('items__unit_price')))['total'] or 0
+    cancelled_value = cancelled_projects.aggregate(total=Sum('total_value'))['total'] or 0
 
     data_summary = f"""
     - ช่วงเวลา: {calendar.month_name[month_filter]} {year_filter}
@@ -2805,7 +2873,7 @@ def ai_dashboard_analysis(request):
     """
 
     try:
-        analysis_result = get_gemini_analysis(data_summary)
+        analysis_result = get_gemini_analysis(data_summary, user=request.user)
         
         return JsonResponse({
             'status': 'success',
@@ -3197,9 +3265,9 @@ def gps_tracking_report(request):
     แสดงผลบนแผนที่ Leaflet พร้อมเส้นทาง (Polyline)
     """
     from .models import TechnicianGPSLog, ServiceQueueItem
+    from .gps_rollup import day_filter
     from django.contrib.auth import get_user_model
     from django.utils import timezone
-    import json as json_lib
 
     User = get_user_model()
     today = timezone.localdate()
@@ -3218,7 +3286,7 @@ def gps_tracking_report(request):
 
     # กรองข้อมูล GPS ตามวันที่
     qs = TechnicianGPSLog.objects.filter(
-        timestamp__date=report_date
+        **day_filter(report_date)
     ).select_related('user', 'queue_item', 'queue_item__project')
 
     if user_can_view_all(request.user):
@@ -3236,27 +3304,13 @@ def gps_tracking_report(request):
     for log in logs:
         grouped[log.user.username].append(log)
 
-    # สร้าง JSON สำหรับ Leaflet map
-    map_data = {}
-    for username, user_logs in grouped.items():
-        map_data[username] = [
-            {
-                'lat': float(log.latitude),
-                'lng': float(log.longitude),
-                'check_type': log.get_check_type_display(),
-                'check_type_key': log.check_type,
-                'location_name': log.location_name or 'ไม่ระบุชื่อ',
-                'notes': log.notes,
-                'time': timezone.localtime(log.timestamp).strftime('%H:%M'),
-                'job': log.queue_item.project.name if log.queue_item and log.queue_item.project else '-',
-            }
-            for log in user_logs
-        ]
+    # ข้อมูลแผนที่: เส้นทางแบบย่อ (encoded polyline) + จุดหยุด — จุด TRAVEL ไม่ส่งเป็นรายจุด (ดู gps_route.py)
+    map_data = _gps_map_data(grouped, request.GET.get('zoom'))
 
     return render(request, 'pms/gps_tracking_report.html', {
         'logs': logs,
         'grouped': dict(grouped),
-        'map_data_json': json_lib.dumps(map_data, ensure_ascii=False),
+        'map_data': map_data,
         'report_date': report_date,
         'today': today,
         'technicians': technicians,
@@ -3264,22 +3318,48 @@ def gps_tracking_report(request):
     })
 
 
+def _gps_map_data(grouped, zoom=None, offsets=None):
+    """
+    grouped: {username: [TechnicianGPSLog เรียงตามเวลา]}
+    Returns: {'labels': {check_type: ชื่อ}, 'users': {username: route_payload}} สำหรับ gps_tracking_report.html
+    """
+    from .gps_route import route_payload
+    from .models import TechnicianGPSLog
+
+    try:
+        zoom = int(zoom) if zoom else None
+    except ValueError:
+        zoom = None
+    offsets = offsets or {}
+    return {
+        'labels': dict(TechnicianGPSLog.CheckType.choices),
+        'users': {
+            username: route_payload(user_logs, zoom=zoom, job=True, offset=offsets.get(username, 0))
+            for username, user_logs in grouped.items()
+        },
+    }
+
+
 @login_required
 def gps_live_data(request):
     """
     JSON API สำหรับ AJAX polling — คืนค่า GPS log ของวันนี้ในรูปแบบ JSON
     ใช้กับปุ่ม Live บนหน้า GPS Tracking Report
+    ?since_id=<id>: ส่งเฉพาะ log ที่ใหม่กว่า — เส้นทาง ('route') เป็นส่วนต่อท้าย ให้ client ต่อกับเส้นเดิม
     """
     from .models import TechnicianGPSLog
+    from .gps_rollup import day_filter
     from django.utils import timezone
     from collections import defaultdict
 
     today = timezone.localdate()
     selected_user_id = request.GET.get('user_id')
+    try:
+        since_id = int(request.GET.get('since_id') or 0)
+    except ValueError:
+        since_id = 0
 
-    qs = TechnicianGPSLog.objects.filter(
-        timestamp__date=today
-    ).select_related('user', 'queue_item', 'queue_item__project')
+    qs = TechnicianGPSLog.objects.filter(**day_filter(today))
 
     if user_can_view_all(request.user):
         if selected_user_id:
@@ -3287,28 +3367,27 @@ def gps_live_data(request):
     else:
         qs = qs.filter(user=request.user)
 
-    logs = list(qs.order_by('user__username', 'timestamp'))
+    offsets = {}
+    if since_id:
+        # จำนวน log ที่ client มีแล้วของแต่ละคน — ใช้ต่อเลขลำดับจุด
+        offsets = dict(
+            qs.filter(id__lte=since_id).order_by().values('user__username')
+            .annotate(n=Count('id')).values_list('user__username', 'n')
+        )
+        qs = qs.filter(id__gt=since_id)
+
+    logs = list(qs.select_related('user', 'queue_item', 'queue_item__project').order_by('user__username', 'timestamp'))
     grouped = defaultdict(list)
     for log in logs:
         grouped[log.user.username].append(log)
 
-    map_data = {}
-    for username, user_logs in grouped.items():
-        map_data[username] = [
-            {
-                'lat': float(log.latitude),
-                'lng': float(log.longitude),
-                'check_type': log.get_check_type_display(),
-                'check_type_key': log.check_type,
-                'location_name': log.location_name or 'ไม่ระบุชื่อ',
-                'notes': log.notes,
-                'time': timezone.localtime(log.timestamp).strftime('%H:%M'),
-                'job': log.queue_item.project.name if log.queue_item and log.queue_item.project else '-',
-            }
-            for log in user_logs
-        ]
-
-    return JsonResponse({'map_data': map_data, 'total': len(logs)})
+    data = _gps_map_data(grouped, request.GET.get('zoom'), offsets)
+    data.update(
+        since_id=since_id,
+        last_id=max((log.id for log in logs), default=since_id),
+        total=len(logs),
+    )
+    return JsonResponse(data)
 
 
 @login_required
@@ -3330,7 +3409,8 @@ def gps_summary_report(request):
     - User ทั่วไปเห็นเฉพาะข้อมูลตัวเอง
     - คลิกที่ช่องใดช่องหนึ่งเพื่อไปยังรายงานรายวันของวันและคนนั้น
     """
-    from .models import TechnicianGPSLog
+    from .models import TechnicianDaySummary, TechnicianGPSLog
+    from .gps_rollup import day_filter, period_filter
     from django.contrib.auth import get_user_model
     from django.utils import timezone
     from collections import defaultdict
@@ -3360,7 +3440,7 @@ def gps_summary_report(request):
         day_short = DAY_SHORT[report_date.weekday()]
 
         qs_day = TechnicianGPSLog.objects.filter(
-            timestamp__date=report_date
+            **day_filter(report_date)
         ).select_related('user').order_by('timestamp')
         if not user_can_view_all(request.user):
             qs_day = qs_day.filter(user=request.user)
@@ -3427,7 +3507,7 @@ def gps_summary_report(request):
 
         # Satisfaction for the day
         sat_qs_day = _CS.objects.filter(
-            gps_log__timestamp__date=report_date
+            **day_filter(report_date, 'gps_log__timestamp')
         ).select_related('gps_log__user').order_by('created_at')
         if not user_can_view_all(request.user):
             sat_qs_day = sat_qs_day.filter(gps_log__user=request.user)
@@ -3528,45 +3608,34 @@ def gps_summary_report(request):
     start_date = date(year, month, 1)
     end_date   = date(year, month, last_day)
 
-    # Query GPS logs ในเดือนนั้น
-    qs = TechnicianGPSLog.objects.filter(
-        timestamp__date__gte=start_date,
-        timestamp__date__lte=end_date,
-    ).select_related('user').order_by('timestamp')
+    # สรุปรายช่างรายวันของเดือนนั้นจากตารางสรุป (pms/gps_rollup.py) — ไม่ต้องอ่าน log ดิบทั้งเดือน
+    qs = TechnicianDaySummary.objects.filter(
+        day__gte=start_date,
+        day__lte=end_date,
+    ).select_related('user').order_by('day', 'first_at')
 
     if not (user_can_view_all(request.user)):
         qs = qs.filter(user=request.user)
 
-    # จัดกลุ่ม: raw_data[date_obj][username] = {count, first_ts, last_ts, types, ci_count, co_count, go_work_count, back_office_count}
-    raw_data = defaultdict(lambda: defaultdict(lambda: {
-        'count': 0, 'first': None, 'last': None, 'types': set(),
-        'ci_count': 0, 'co_count': 0,
-        'go_work_count': 0, 'back_office_count': 0,
-    }))
+    # จัดกลุ่ม: raw_data[date_obj][username] = {count, first, last, ci_count, co_count, go_work_count, back_office_count, travel_count}
+    raw_data = defaultdict(dict)
     users_ordered = {}  # ใช้ dict เพื่อรักษาลำดับ insertion (Python 3.7+)
 
     user_id_map = {}  # {username: user_id}
-    for log in qs:
-        d = timezone.localtime(log.timestamp).date()
-        uname = log.user.username
+    for row in qs:
+        uname = row.user.username
         users_ordered[uname] = True
-        user_id_map[uname] = log.user_id
-        cell = raw_data[d][uname]
-        cell['count'] += 1
-        local_ts = timezone.localtime(log.timestamp)
-        if cell['first'] is None or local_ts < cell['first']:
-            cell['first'] = local_ts
-        if cell['last'] is None or local_ts > cell['last']:
-            cell['last'] = local_ts
-        cell['types'].add(log.check_type)
-        if log.check_type in ('ON_SITE', 'CHECK_IN'):
-            cell['ci_count'] += 1
-        elif log.check_type == 'CHECK_OUT':
-            cell['co_count'] += 1
-        elif log.check_type == 'GO_WORK':
-            cell['go_work_count'] += 1
-        elif log.check_type == 'BACK_OFFICE':
-            cell['back_office_count'] += 1
+        user_id_map[uname] = row.user_id
+        raw_data[row.day][uname] = {
+            'count':             row.log_count,
+            'first':             timezone.localtime(row.first_at),
+            'last':              timezone.localtime(row.last_at),
+            'ci_count':          row.ci_count,
+            'co_count':          row.check_out_count,
+            'go_work_count':     row.go_work_count,
+            'back_office_count': row.back_office_count,
+            'travel_count':      row.travel_count,
+        }
 
     all_users = sorted(users_ordered.keys())
 
@@ -3601,9 +3670,9 @@ def gps_summary_report(request):
                     'count':             cell['count'],
                     'first':             cell['first'].strftime('%H:%M') if cell['first'] else '',
                     'last':              cell['last'].strftime('%H:%M') if cell['last'] else '',
-                    'has_ci':            'ON_SITE' in cell['types'] or 'CHECK_IN' in cell['types'],
-                    'has_co':            'CHECK_OUT' in cell['types'],
-                    'has_travel':        'TRAVEL' in cell['types'],
+                    'has_ci':            ci_c > 0,
+                    'has_co':            co_c > 0,
+                    'has_travel':        cell['travel_count'] > 0,
                     'ci_count':          ci_c,
                     'co_count':          co_c,
                     'go_work_count':     gw_c,
@@ -3663,8 +3732,7 @@ def gps_summary_report(request):
     # ─── Customer Satisfaction data ────────────────────────────────────
     from .models import CustomerSatisfaction
     sat_qs = CustomerSatisfaction.objects.filter(
-        gps_log__timestamp__date__gte=start_date,
-        gps_log__timestamp__date__lte=end_date,
+        **period_filter(start_date, end_date, 'gps_log__timestamp'),
     ).select_related('gps_log__user').order_by('-created_at')
 
     if not (user_can_view_all(request.user)):
@@ -3774,6 +3842,7 @@ def gps_daily_summary(request):
     • งานในคิวที่เสร็จ/อยู่ระหว่างดำเนินการในวันนั้น
     """
     from .models import TechnicianGPSLog, CustomerSatisfaction, ServiceQueueItem
+    from .gps_rollup import day_filter
     from django.contrib.auth import get_user_model
     from django.utils import timezone
     from datetime import date, timedelta
@@ -3799,7 +3868,7 @@ def gps_daily_summary(request):
 
     # ── Query GPS logs ──────────────────────────────────────────────────
     gps_qs = TechnicianGPSLog.objects.filter(
-        timestamp__date=report_date
+        **day_filter(report_date)
     ).select_related('user').order_by('timestamp')
     if not user_can_view_all(request.user):
         gps_qs = gps_qs.filter(user=request.user)
@@ -3875,7 +3944,7 @@ def gps_daily_summary(request):
 
     # ── Fetch satisfaction linked to today's CHECK_OUT logs ────────────
     sat_qs = CustomerSatisfaction.objects.filter(
-        gps_log__timestamp__date=report_date
+        **day_filter(report_date, 'gps_log__timestamp')
     ).select_related('gps_log__user')
     if not user_can_view_all(request.user):
         sat_qs = sat_qs.filter(gps_log__user=request.user)
@@ -4100,6 +4169,7 @@ def gps_warn_status_api(request):
     """
     from django.http import JsonResponse
     from .models import TechnicianGPSLog
+    from .gps_rollup import day_filter
     from django.utils import timezone
     from django.contrib.auth import get_user_model
 
@@ -4113,7 +4183,7 @@ def gps_warn_status_api(request):
 
     # ดึง GPS log ทั้งหมดของวันนี้
     logs = TechnicianGPSLog.objects.filter(
-        timestamp__date=today
+        **day_filter(today)
     ).select_related('user').order_by('user__username', 'timestamp')
 
     # จัดกลุ่ม
@@ -4213,6 +4283,7 @@ def gps_track_warn_notify(request):
                 {
                     'type':      'chat_message',
                     'id':        msg_obj.id,
+                    'seq':       msg_obj.seq,
                     'message':   msg_html,
                     'username':  request.user.username,
                     'user_id':   request.user.id,
@@ -4258,6 +4329,7 @@ def gps_daily_summary_send_to_chat(request):
     from datetime import date, timedelta
     from collections import defaultdict
     from .models import TechnicianGPSLog, CustomerSatisfaction, ServiceQueueItem
+    from .gps_rollup import day_filter
     from django.contrib.auth import get_user_model
 
     User = get_user_model()
@@ -4278,7 +4350,7 @@ def gps_daily_summary_send_to_chat(request):
 
     # ── Reuse the same query logic as gps_daily_summary ─────────────────
     gps_qs = TechnicianGPSLog.objects.filter(
-        timestamp__date=report_date
+        **day_filter(report_date)
     ).select_related('user').order_by('timestamp')
 
     tech_raw = {}
@@ -4332,7 +4404,7 @@ def gps_daily_summary_send_to_chat(request):
                 })
 
     sat_qs = CustomerSatisfaction.objects.filter(
-        gps_log__timestamp__date=report_date
+        **day_filter(report_date, 'gps_log__timestamp')
     ).select_related('gps_log__user')
     for s in sat_qs:
         uname = s.gps_log.user.username
@@ -4617,6 +4689,8 @@ def gps_daily_summary_send_to_chat(request):
             f'chat_{chat_room.id}',
             {
                 'type': 'chat_message',
+                'id': msg.id,
+                'seq': msg.seq,
                 'message': full_html,
                 'username': request.user.username,
                 'user_id': request.user.id,
@@ -4646,6 +4720,8 @@ def gps_map_embed(request, username, date_str):
     """
     from django.http import HttpResponse
     from .models import TechnicianGPSLog
+    from .gps_rollup import day_filter, summarize
+    from .gps_route import route_payload
     from django.utils import timezone
     from datetime import date
     import json as json_lib
@@ -4655,10 +4731,10 @@ def gps_map_embed(request, username, date_str):
     except (ValueError, TypeError):
         report_date = timezone.localdate()
 
-    logs = TechnicianGPSLog.objects.filter(
+    logs = list(TechnicianGPSLog.objects.filter(
         user__username=username,
-        timestamp__date=report_date,
-    ).order_by('timestamp')
+        **day_filter(report_date),
+    ).order_by('timestamp'))
 
     TYPE_COLOR = {
         'GO_WORK':     '#2563eb',
@@ -4677,25 +4753,26 @@ def gps_map_embed(request, username, date_str):
         'CHECK_OUT': 'เสร็จงาน', 'BACK_OFFICE': 'กลับออฟฟิศ', 'TRAVEL': 'เดินทาง',
     }
 
-    points = []
-    for i, log in enumerate(logs, 1):
-        lat = float(log.latitude)
-        lng = float(log.longitude)
-        if lat == 0 and lng == 0:
-            continue
-        lt = timezone.localtime(log.timestamp)
-        points.append({
-            'i': i, 'lat': lat, 'lng': lng,
-            'type': log.check_type,
-            'color': TYPE_COLOR.get(log.check_type, '#64748b'),
-            'icon': TYPE_ICON.get(log.check_type, '•'),
-            'label': TYPE_LABEL.get(log.check_type, log.check_type),
-            'time': lt.strftime('%H:%M'),
-            'location': log.location_name or '',
-            'notes': log.notes or '',
-        })
+    # เส้นทางแบบย่อ (encoded polyline) + marker เฉพาะจุดหยุดและจุดล่าสุด — ระยะทางคิดจากทุกจุด
+    zoom = request.GET.get('zoom', '')
+    route = route_payload(logs, zoom=int(zoom) if zoom.isdigit() else None)
+    stops = route['stops']
+    if route['last'] and route['last']['type'] == 'TRAVEL':
+        stops = stops + [route['last']]
+    n_points = sum(1 for log in logs if not (float(log.latitude) == 0 and float(log.longitude) == 0))
+    distance_km = summarize([(log.check_type, log.timestamp, log.latitude, log.longitude) for log in logs])['distance_km']
+
+    data_json = json_lib.dumps({
+        'route': route['route'],
+        'stops': [
+            {'i': p['n'] + 1, 'lat': p['lat'], 'lng': p['lng'], 'type': p['type'], 'time': p['time'],
+             'location': p['location'], 'notes': p['notes']}
+            for p in stops
+        ],
+        'km': distance_km,
+        'color': TYPE_COLOR, 'icon': TYPE_ICON, 'label': TYPE_LABEL,
+    }, ensure_ascii=False).replace('</', '<\\/')
 
-    points_json = json_lib.dumps(points, ensure_ascii=False)
     date_th = report_date.strftime('%d/%m/') + str(report_date.year + 543)
 
     html = f"""<!DOCTYPE html>
@@ -4717,13 +4794,33 @@ def gps_map_embed(request, username, date_str):
 <div id="header">
   <span>👷</span>
   <strong>{username}</strong>
-  <span style="opacity:0.7;">· {date_th} · {len(points)} จุด</span>
+  <span style="opacity:0.7;">· {date_th} · {n_points} จุด</span>
 </div>
 <div id="map"></div>
 <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
 <script>
-const PTS = {points_json};
-if (PTS.length === 0) {{
+const DATA = {data_json};
+
+// Google encoded polyline → [[lat, lng], ...]
+function _decodeRoute(str) {{
+  var coords = [], index = 0, lat = 0, lng = 0;
+  while (index < str.length) {{
+    [0, 1].forEach(function(axis) {{
+      var shift = 0, result = 0, b;
+      do {{
+        b = str.charCodeAt(index++) - 63;
+        result |= (b & 0x1f) << shift;
+        shift += 5;
+      }} while (b >= 0x20);
+      var delta = (result & 1) ? ~(result >> 1) : (result >> 1);
+      if (axis === 0) lat += delta; else lng += delta;
+    }});
+    coords.push([lat / 1e5, lng / 1e5]);
+  }}
+  return coords;
+}}
+
+if (DATA.stops.length === 0) {{
   document.getElementById('map').innerHTML = '<div style="color:#94a3b8;text-align:center;padding:40px;font-size:0.9rem;">ไม่มีข้อมูล GPS</div>';
 }} else {{
   const map = L.map('map');
@@ -4731,18 +4828,20 @@ if (PTS.length === 0) {{
     attribution:'© OpenStreetMap', maxZoom:18
   }}).addTo(map);
 
-  const lls = [];
-  PTS.forEach(function(p, idx) {{
+  const lls = _decodeRoute(DATA.route);
+  const bounds = L.latLngBounds(lls);
+  DATA.stops.forEach(function(p) {{
+    const color = DATA.color[p.type] || '#64748b';
     const icon = L.divIcon({{
-      html: '<div style="background:' + p.color + ';color:white;width:26px;height:26px;border-radius:50%;' +
+      html: '<div style="background:' + color + ';color:white;width:26px;height:26px;border-radius:50%;' +
             'display:flex;align-items:center;justify-content:center;font-size:0.72rem;font-weight:700;' +
             'border:2px solid white;box-shadow:0 2px 5px rgba(0,0,0,0.35);">' + p.i + '</div>',
       className:'', iconSize:[26,26], iconAnchor:[13,13]
     }});
     const ll = [p.lat, p.lng];
-    lls.push(ll);
+    bounds.extend(ll);
     const popup = '<div style="font-size:0.8rem;min-width:150px;">' +
-      '<div style="font-weight:700;color:' + p.color + '">' + p.icon + ' ' + p.label + '</div>' +
+      '<div style="font-weight:700;color:' + color + '">' + (DATA.icon[p.type] || '•') + ' ' + (DATA.label[p.type] || p.type) + '</div>' +
       '<div>' + p.time + '</div>' +
       (p.location ? '<div style="color:#2563eb">📍 ' + p.location + '</div>' : '') +
       (p.notes ? '<div style="color:#64748b;font-size:0.72rem">' + p.notes + '</div>' : '') +
@@ -4753,22 +4852,8 @@ if (PTS.length === 0) {{
   if (lls.length > 1) {{
     L.polyline(lls, {{color:'#3b82f6',weight:3,opacity:0.75}}).addTo(map);
 
-    // ── Haversine distance (km) ──────────────────────────────────────────
-    function _haversine(p1, p2) {{
-      var R = 6371;
-      var dLat = (p2[0] - p1[0]) * Math.PI / 180;
-      var dLng = (p2[1] - p1[1]) * Math.PI / 180;
-      var a = Math.sin(dLat/2)*Math.sin(dLat/2) +
-              Math.cos(p1[0]*Math.PI/180)*Math.cos(p2[0]*Math.PI/180)*
-              Math.sin(dLng/2)*Math.sin(dLng/2);
-      return R * 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1-a));
-    }}
-
-    // ── Total distance display ───────────────────────────────────────────
-    var totalKm = 0;
-    for (var i = 0; i < lls.length - 1; i++) {{
-      totalKm += _haversine(lls[i], lls[i+1]);
-    }}
+    // ── Total distance display (คำนวณที่ server จากทุกจุด ไม่ใช่เส้นที่ย่อแล้ว) ──
+    var totalKm = DATA.km;
     var distLabel = totalKm >= 1
       ? totalKm.toFixed(1) + ' km'
       : (totalKm * 1000).toFixed(0) + ' m';
@@ -4864,7 +4949,7 @@ if (PTS.length === 0) {{
   }};
   legend.addTo(map);
 
-  map.fitBounds(L.latLngBounds(lls), {{padding:[20,20]}});
+  map.fitBounds(bounds, {{padding:[20,20]}});
 }}
 </script>
 </body>
@@ -4877,11 +4962,14 @@ def gps_map_image(request, username, date_str):
     """
     Generate PNG map image of a technician's GPS route using OSM tiles + Pillow.
     Returns image/png response — ใช้ใน <img src="..."> ในห้องแชทได้เลย
+    tile มาจาก cache บนดิสก์ และรูปที่วาดแล้วถูก cache ตาม (ช่าง, วัน, log ล่าสุด) — pms/map_tiles.py
     """
-    import math, io, requests as req_lib
+    import math, io
     from PIL import Image, ImageDraw, ImageFont
     from django.http import HttpResponse, Http404
     from .models import TechnicianGPSLog
+    from .gps_rollup import day_filter
+    from .map_tiles import get_rendered, get_tile_cache, rendered_key, set_rendered
     from django.utils import timezone
     from datetime import date
 
@@ -4890,10 +4978,17 @@ def gps_map_image(request, username, date_str):
     except (ValueError, TypeError):
         raise Http404
 
-    logs = TechnicianGPSLog.objects.filter(
+    logs = list(TechnicianGPSLog.objects.filter(
         user__username=username,
-        timestamp__date=report_date,
-    ).order_by('timestamp')
+        **day_filter(report_date),
+    ).order_by('timestamp').only('id', 'user_id', 'latitude', 'longitude', 'check_type'))
+
+    cache_key = None
+    if logs:
+        cache_key = rendered_key(logs[0].user_id, report_date, max(log.id for log in logs), len(logs))
+        cached = get_rendered(cache_key)
+        if cached:
+            return HttpResponse(cached, content_type='image/png')
 
     points = []
     for log in logs:
@@ -4964,19 +5059,19 @@ def gps_map_image(request, username, date_str):
     canvas_h = (tiles_y + 1) * TILE_SIZE
     canvas = Image.new('RGB', (canvas_w, canvas_h), '#e2e8f0')
 
-    headers = {'User-Agent': 'PMS-GPS-Report/1.0 (internal app)'}
-    for tx in range(tile_x0, tile_x0 + tiles_x + 1):
-        for ty in range(tile_y0, tile_y0 + tiles_y + 1):
-            tile_url = f'https://tile.openstreetmap.org/{zoom}/{tx}/{ty}.png'
-            try:
-                r = req_lib.get(tile_url, headers=headers, timeout=4)
-                if r.status_code == 200:
-                    tile_img = Image.open(io.BytesIO(r.content)).convert('RGB')
-                    px = (tx - tile_x0) * TILE_SIZE
-                    py = (ty - tile_y0) * TILE_SIZE
-                    canvas.paste(tile_img, (px, py))
-            except Exception:
-                pass
+    # tile จาก cache บนดิสก์ — ที่ขาดดึงจากแหล่ง tile พร้อมกัน
+    coords = [(tx, ty)
+              for tx in range(tile_x0, tile_x0 + tiles_x + 1)
+              for ty in range(tile_y0, tile_y0 + tiles_y + 1)]
+    tiles = get_tile_cache().get_many(zoom, coords)
+    for (tx, ty), data in tiles.items():
+        try:
+            tile_img = Image.open(io.BytesIO(data)).convert('RGB')
+        except Exception:
+            continue
+        px = (tx - tile_x0) * TILE_SIZE
+        py = (ty - tile_y0) * TILE_SIZE
+        canvas.paste(tile_img, (px, py))
 
     # Offset so center of canvas = center of map
     offset_x = canvas_w // 2 - int((cx - int(cx)) * TILE_SIZE) - (int(cx) - tile_x0) * TILE_SIZE
@@ -5062,7 +5157,9 @@ def gps_map_image(request, username, date_str):
 
     buf = io.BytesIO()
     final.save(buf, 'PNG', optimize=True)
-    buf.seek(0)
+    # เก็บรูปเฉพาะเมื่อได้ tile ครบ — tile ที่ดึงไม่สำเร็จจะลองใหม่ครั้งหน้า
+    if len(tiles) == len(coords):
+        set_rendered(cache_key, buf.getvalue())
     return HttpResponse(buf.getvalue(), content_type='image/png')
 
 
@@ -5072,7 +5169,7 @@ def gps_summary_export(request):
     Export รายงานสรุป GPS รายเดือน เป็น CSV
     """
     import csv
-    from .models import TechnicianGPSLog
+    from .models import TechnicianDaySummary
     from django.utils import timezone
     from collections import defaultdict
     import calendar
@@ -5097,30 +5194,25 @@ def gps_summary_export(request):
     start_date  = date(year, month, 1)
     end_date    = date(year, month, last_day)
 
-    qs = TechnicianGPSLog.objects.filter(
-        timestamp__date__gte=start_date,
-        timestamp__date__lte=end_date,
-    ).select_related('user').order_by('timestamp')
+    # อ่านจากตารางสรุปรายวัน (pms/gps_rollup.py) แทน log ดิบทั้งเดือน
+    qs = TechnicianDaySummary.objects.filter(
+        day__gte=start_date,
+        day__lte=end_date,
+    ).select_related('user').order_by('day', 'first_at')
 
     if not (user_can_view_all(request.user)):
         qs = qs.filter(user=request.user)
 
-    raw_data = defaultdict(lambda: defaultdict(lambda: {
-        'count': 0, 'first': None, 'last': None, 'types': set()
-    }))
+    raw_data = defaultdict(dict)
     users_ordered = {}
-    for log in qs:
-        d     = timezone.localtime(log.timestamp).date()
-        uname = log.user.username
+    for summary in qs:
+        uname = summary.user.username
         users_ordered[uname] = True
-        cell  = raw_data[d][uname]
-        cell['count'] += 1
-        local_ts = timezone.localtime(log.timestamp)
-        if cell['first'] is None or local_ts < cell['first']:
-            cell['first'] = local_ts
-        if cell['last'] is None or local_ts > cell['last']:
-            cell['last'] = local_ts
-        cell['types'].add(log.check_type)
+        raw_data[summary.day][uname] = {
+            'count': summary.log_count,
+            'first': timezone.localtime(summary.first_at),
+            'last':  timezone.localtime(summary.last_at),
+        }
 
     all_users   = sorted(users_ordered.keys())
     user_totals = defaultdict(int)
@@ -5170,9 +5262,9 @@ def gps_technician_stats(request):
     """
     กราฟสถิติช่างเทคนิครายบุคคล — งานที่ได้รับมอบหมาย + GPS check-in/out ย้อนหลัง 12 เดือน
     """
-    from .models import TechnicianGPSLog, ServiceQueueItem
+    from .models import TechnicianDaySummary, ServiceQueueItem
     from django.utils import timezone
-    from django.db.models import Count
+    from django.db.models import Count, Sum
     from django.db.models.functions import ExtractYear, ExtractMonth
     from collections import defaultdict
     from datetime import date
@@ -5200,7 +5292,7 @@ def gps_technician_stats(request):
 
     # หา users ที่มี GPS log หรือ job ในช่วง 12 เดือน
     gps_user_ids = set(
-        TechnicianGPSLog.objects.filter(timestamp__date__gte=start_date)
+        TechnicianDaySummary.objects.filter(day__gte=start_date)
         .values_list('user_id', flat=True).distinct()
     )
     job_user_ids = set(filter(None, (
@@ -5216,18 +5308,23 @@ def gps_technician_stats(request):
 
     users = User.objects.filter(pk__in=all_user_ids).order_by('username')
 
-    # GPS logs — grouping ด้วย Python เพื่อรองรับ timezone ที่ถูกต้อง
-    gps_logs = TechnicianGPSLog.objects.filter(
-        timestamp__date__gte=start_date,
-        user__in=users,
-    ).only('user_id', 'check_type', 'timestamp')
+    # GPS รายเดือนจากตารางสรุปรายวัน (วันตามเวลาท้องถิ่นอยู่แล้ว) — รวมใน SQL
+    gps_rows = (
+        TechnicianDaySummary.objects
+        .filter(day__gte=start_date, user__in=users)
+        .annotate(yr=ExtractYear('day'), mn=ExtractMonth('day'))
+        .values('user_id', 'yr', 'mn')
+        .annotate(check_in=Sum('check_in_count'), check_out=Sum('check_out_count'))
+        .order_by()
+    )
 
     # gps_data[user_id][(year, month)][check_type] = count
-    gps_data = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    for log in gps_logs:
-        local_ts = timezone.localtime(log.timestamp)
-        key = (local_ts.year, local_ts.month)
-        gps_data[log.user_id][key][log.check_type] += 1
+    gps_data = defaultdict(lambda: defaultdict(dict))
+    for row in gps_rows:
+        gps_data[row['user_id']][(row['yr'], row['mn'])] = {
+            'CHECK_IN': row['check_in'] or 0,
+            'CHECK_OUT': row['check_out'] or 0,
+        }
 
     # Jobs per user per month ผ่าน assigned_teams → members
     job_rows = (
@@ -5284,7 +5381,8 @@ def gps_technician_stats(request):
 
 @login_required
 def work_summary_report(request):
-    from .models import TechnicianGPSLog, CustomerSatisfaction, ServiceQueueItem, ServiceTeam
+    from .models import TechnicianGPSLog, TechnicianDaySummary, CustomerSatisfaction, ServiceQueueItem, ServiceTeam
+    from .gps_rollup import period_filter
     from datetime import timedelta
     from collections import defaultdict
     import json as json_lib
@@ -5307,7 +5405,7 @@ def work_summary_report(request):
 
     gps_qs = (
         TechnicianGPSLog.objects
-        .filter(timestamp__date__gte=date_from, timestamp__date__lte=date_to)
+        .filter(**period_filter(date_from, date_to))
         .select_related("user", "queue_item", "queue_item__project", "queue_item__project__customer")
         .prefetch_related("queue_item__assigned_teams")
         .order_by("user_id", "timestamp")
@@ -5318,8 +5416,7 @@ def work_summary_report(request):
         gps_qs = gps_qs.filter(user_id=uid_filter)
 
     sat_qs = CustomerSatisfaction.objects.filter(
-        gps_log__timestamp__date__gte=date_from,
-        gps_log__timestamp__date__lte=date_to,
+        **period_filter(date_from, date_to, 'gps_log__timestamp'),
     ).select_related("gps_log")
     if not user_can_view_all(request.user):
         sat_qs = sat_qs.filter(gps_log__user=request.user)
@@ -5395,23 +5492,17 @@ def work_summary_report(request):
     total_minutes = sum(s["duration_min"] for s in all_sessions)
 
     # ── Distance & Fuel calculation for each tech ─────────────────────
+    # ระยะทางรายวันคำนวณไว้แล้วในตารางสรุป GPS (pms/gps_rollup.py)
     tech_resource = defaultdict(lambda: {"total_dist": 0.0, "fuel_liters": 0.0, "fuel_cost": 0.0})
-    for (uid, _day), logs in by_user_date.items():
-        if not logs: continue
-        uname = logs[0].user.username
-        valid_pts = [(float(l.latitude), float(l.longitude)) for l in logs if float(l.latitude) != 0 and float(l.longitude) != 0]
-        if len(valid_pts) > 1:
-            from math import sin, cos, sqrt, atan2, radians
-            def haversine(lat1, lon1, lat2, lon2):
-                R = 6371.0
-                dlat, dlon = radians(lat2 - lat1), radians(lon2 - lon1)
-                a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-                return R * 2 * atan2(sqrt(a), sqrt(1 - a))
-            d_sum = sum(haversine(valid_pts[i][0], valid_pts[i][1], valid_pts[i+1][0], valid_pts[i+1][1]) 
-                        for i in range(len(valid_pts)-1))
-            tech_resource[uname]["total_dist"] += d_sum
-            tech_resource[uname]["fuel_liters"] += (d_sum / 12.0)
-            tech_resource[uname]["fuel_cost"] += (d_sum / 12.0 * 35.0)
+    day_qs = TechnicianDaySummary.objects.filter(day__gte=date_from, day__lte=date_to, distance_km__gt=0)
+    if not user_can_view_all(request.user):
+        day_qs = day_qs.filter(user=request.user)
+    elif uid_filter:
+        day_qs = day_qs.filter(user_id=uid_filter)
+    for uname, d_sum in day_qs.values_list("user__username", "distance_km"):
+        tech_resource[uname]["total_dist"] += d_sum
+        tech_resource[uname]["fuel_liters"] += (d_sum / 12.0)
+        tech_resource[uname]["fuel_cost"] += (d_sum / 12.0 * 35.0)
 
     by_tech = defaultdict(lambda: {"sessions": 0, "minutes": 0, "locs": set(), "sat": [], "u_id": None})
     by_type = defaultdict(lambda: {"count": 0, "minutes": 0})
@@ -5508,10 +5599,35 @@ def work_summary_ai_analysis(request):
         summary = body.get("summary", "")
     except Exception:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
-    analysis = get_gemini_work_analysis(summary)
+    analysis = get_gemini_work_analysis(summary, user=request.user)
     return JsonResponse({"status": "success", "analysis": analysis})
 
 
+@login_required
+def work_summary_ai_stream(request):
+    """work_summary_ai_analysis แบบ SSE — body เดียวกัน ; ทยอยส่งข้อความจาก AI ตามที่ได้รับ"""
+    from django.conf import settings
+    from utils.llm_stream import sse_response, stream_llm
+    from .ai_utils import GEMINI_MODEL, build_work_analysis_prompt
+    import json as json_lib
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405)
+    try:
+        body    = json_lib.loads(request.body)
+        summary = body.get("summary", "")
+    except Exception:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not getattr(settings, "GEMINI_API_KEY", None):
+        return JsonResponse({"error": "ไม่พบคีย์ Gemini API ในระบบ (GEMINI_API_KEY is missing in settings)"}, status=500)
+
+    user = request.user
+
+    def events():
+        yield from stream_llm(build_work_analysis_prompt(summary), 'pms_report', GEMINI_MODEL, user=user)
+
+    return sse_response(events)
+
+
 @login_required
 def installation_report(request):
     """
@@ -5735,9 +5851,9 @@ def owner_sales_report(request):
     end_date = timezone.make_aware(datetime(e_y, e_m, last_day, 23, 59, 59))
 
     # --- Base Query ---
-    # Annotate total project value (items count * unit price)
+    # มูลค่าโครงการจากฟิลด์ total_value (อัปเดตเมื่อ ProductItem เปลี่ยน) — ไม่ต้อง join items
     projects = Project.objects.annotate(
-        val=Sum(F('items__quantity') * F('items__unit_price'))
+        val=F('total_value')
     ).filter(val__gt=0, created_at__range=[start_date, end_date])
 
     # Applying secondary filters
@@ -5832,11 +5948,11 @@ def owner_sales_report(request):
     # --- Chart Data Aggregation ---
     # Monthly aggregate for the filtered set
     monthly_data = projects.annotate(month=TruncMonth('created_at')).values('month')\
-        .annotate(total=Sum(F('items__quantity') * F('items__unit_price'))).order_by('month')
+        .annotate(total=Sum('total_value')).order_by('month')
     
     # Yearly aggregate
     yearly_data = projects.annotate(year=TruncYear('created_at')).values('year')\
-        .annotate(total=Sum(F('items__quantity') * F('items__unit_price'))).order_by('year')
+        .annotate(total=Sum('total_value')).order_by('year')
 
     chart_months = [d['month'].strftime('%b %Y') for d in monthly_data]
     chart_month_values = [float(d['total'] or 0) for d in monthly_data]
@@ -5847,9 +5963,9 @@ def owner_sales_report(request):
     # --- Render ---
     context = {
         'projects': projects,
-        'project_owners': ProjectOwner.objects.annotate(
-            total_sales=Sum(F('projects__items__quantity') * F('projects__items__unit_price'))
-        ).filter(total_sales__gt=0).order_by('name'),
+        'project_owners': ProjectOwner.objects.filter(
+            pk__in=ProjectSalesFact.objects.filter(created_value__gt=0).values('owner_id')
+        ).order_by('name'),
         'status_choices': Project.Status.choices,
         'title': 'รายงานการขายสรุปตามเจ้าของโครงการ',
         'search_q': search_q,
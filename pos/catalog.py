@@ -0,0 +1,43 @@
+# ====== catalog.py — แคชราคา/สถานะสินค้าในหน่วยความจำของ process สำหรับการคิดเงิน ======
+# เดิม api_process_order ดึง Product ทีละรายการในตะกร้าเพื่ออ่านราคา — ตะกร้าใหญ่ = query มาก
+#
+# - get_catalog: {product_id: (price, is_active)} โหลดจาก DB ครั้งเดียวแล้วเก็บไว้ใน process
+# - invalidate: เรียกจาก signal เมื่อสินค้าถูกบันทึก/ลบ (pos/signals.py)
+#   token เวอร์ชันเก็บใน cache กลาง (DatabaseCache) ทุก worker จึงรู้ว่าต้องโหลดใหม่ แม้ signal เกิดใน process อื่น
+# สต็อกไม่อยู่ในแคช — ตอนคิดเงินอ่านจากแถวที่ล็อก (select_for_update) เสมอ
+
+import threading
+import uuid
+
+from django.core.cache import cache
+
+_VERSION_KEY = 'pos:catalog:version'
+_lock = threading.Lock()
+_state = {'version': None, 'products': {}}
+
+
+def _current_version():
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        cache.add(_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def get_catalog():
+    """{product_id: (price, is_active)} ของสินค้าทั้งหมด"""
+    from .models import Product
+
+    version = _current_version()
+    with _lock:
+        if version is None or _state['version'] != version:
+            _state['products'] = {
+                pk: (price, is_active)
+                for pk, price, is_active in Product.objects.values_list('id', 'price', 'is_active')
+            }
+            _state['version'] = version
+        return _state['products']
+
+
+def invalidate():
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
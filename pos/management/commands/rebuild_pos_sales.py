@@ -0,0 +1,17 @@
+"""
+python manage.py rebuild_pos_sales
+
+สร้างตารางสรุปยอดขายรายวัน DailySalesSummary / DailyProductSales ใหม่ทั้งหมดจาก Order / OrderItem (pos/sales_summary.py)
+ปกติตารางถูกอัปเดตเองหลังคิดเงินทุกครั้ง — ใช้คำสั่งนี้เมื่อแก้ข้อมูลคำสั่งซื้อตรงๆ ใน DB
+"""
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'สร้างตารางสรุปยอดขายรายวันของ POS ใหม่ทั้งหมด'
+
+    def handle(self, *args, **options):
+        from pos.sales_summary import rebuild
+
+        rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'POS daily sales: {rows} แถว'))
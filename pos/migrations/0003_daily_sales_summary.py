@@ -0,0 +1,91 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:20
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, TruncDate
+
+
+def populate_daily_sales(apps, schema_editor):
+    # ตารางสรุปจากคำสั่งซื้อเดิม (ตรรกะเดียวกับ pos.sales_summary.rebuild)
+    Order = apps.get_model('pos', 'Order')
+    OrderItem = apps.get_model('pos', 'OrderItem')
+    DailySalesSummary = apps.get_model('pos', 'DailySalesSummary')
+    DailyProductSales = apps.get_model('pos', 'DailyProductSales')
+    orders = Order.objects.filter(status='COMPLETED')
+
+    rows = (
+        orders.annotate(day=TruncDate('created_at')).values('day', 'payment_method')
+        .annotate(n=Count('id'), amount=Sum('total_amount'), disc=Sum('discount_amount'))
+        .values_list('day', 'payment_method', 'n', 'amount', 'disc').order_by()
+    )
+    DailySalesSummary.objects.bulk_create([
+        DailySalesSummary(day=day, payment_method=method, order_count=n,
+                          total_amount=amount or 0, discount_amount=disc or 0)
+        for day, method, n, amount, disc in rows
+    ], batch_size=1000)
+
+    order_gross = (
+        OrderItem.objects.filter(order=OuterRef('order')).order_by()
+        .values('order').annotate(total=Sum('subtotal')).values('total')
+    )
+    rows = (
+        OrderItem.objects.filter(order__in=orders)
+        .annotate(day=TruncDate('order__created_at'), order_gross=Cast(Subquery(order_gross), FloatField()))
+        .annotate(share=Case(
+            When(order_gross__gt=0, then=(
+                Cast('subtotal', FloatField()) * Cast('order__discount_amount', FloatField()) / F('order_gross')
+            )),
+            default=Value(0.0), output_field=FloatField(),
+        ))
+        .values('day', 'product_id')
+        .annotate(qty=Sum('quantity'), gross=Sum('subtotal'), disc=Sum('share'))
+        .values_list('day', 'product_id', 'qty', 'gross', 'disc').order_by()
+    )
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(day=day, product_id=product_id, quantity=qty or 0, gross=gross or 0,
+                          discount=Decimal(str(disc or 0)).quantize(Decimal('0.01')))
+        for day, product_id, qty, gross, disc in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos', '0002_order_discount_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('payment_method', models.CharField(max_length=50)),
+                ('order_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('discount_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Sales Summaries',
+                'unique_together': {('day', 'payment_method')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('gross', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('discount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='pos.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Product Sales',
+                'unique_together': {('day', 'product')},
+            },
+        ),
+        migrations.RunPython(populate_daily_sales, migrations.RunPython.noop),
+    ]
@@ -122,3 +122,43 @@ class OrderItem(models.Model):
     def __str__(self):
         # แสดงจำนวนและชื่อสินค้า เช่น "2 x นมสด"
         return f"{self.quantity} x {self.product.name}"
+
+
+# ====== ตารางสรุปยอดขายรายวัน (pos/sales_summary.py) ======
+
+class DailySalesSummary(models.Model):
+    """
+    ยอดขายรายวันแยกตามวิธีชำระเงิน (เฉพาะคำสั่งซื้อ COMPLETED)
+    รายงานยอดขายอ่านตารางนี้แทนการรวม Order ทั้งช่วงวันที่ใหม่ทุกครั้ง
+    """
+    day = models.DateField()  # วันที่ขาย (เวลาท้องถิ่น)
+    payment_method = models.CharField(max_length=50)  # วิธีชำระเงิน
+    order_count = models.IntegerField(default=0)  # จำนวนคำสั่งซื้อ
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # ยอดสุทธิหลังส่วนลด
+    discount_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # ส่วนลดรวม
+
+    class Meta:
+        unique_together = ('day', 'payment_method')
+        verbose_name_plural = "Daily Sales Summaries"
+
+    def __str__(self):
+        return f"{self.day} {self.payment_method}: {self.total_amount}"
+
+
+class DailyProductSales(models.Model):
+    """
+    ยอดขายรายวันแยกตามสินค้า (เฉพาะคำสั่งซื้อ COMPLETED)
+    discount คือส่วนลดของคำสั่งซื้อที่กระจายตามสัดส่วน subtotal ของแต่ละรายการ (คำนวณใน SQL)
+    """
+    day = models.DateField()  # วันที่ขาย (เวลาท้องถิ่น)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')  # สินค้า
+    quantity = models.IntegerField(default=0)  # จำนวนที่ขาย
+    gross = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # ยอดขายก่อนส่วนลด
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # ส่วนลดที่กระจายมา
+
+    class Meta:
+        unique_together = ('day', 'product')
+        verbose_name_plural = "Daily Product Sales"
+
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.quantity}"
@@ -0,0 +1,167 @@
+# ====== sales_summary.py — ตารางสรุปยอดขายรายวันของ POS (DailySalesSummary / DailyProductSales) ======
+# เดิม api_sales_report / export_sales_csv prefetch ทุก Order + OrderItem ในช่วงวันที่ แล้วกระจายส่วนลดใน Python
+# วนสองชั้น — ช่วง "ปีนี้" โหลดข้อมูลทั้งปีเข้าหน่วยความจำ
+#
+# โมดูลนี้:
+#   - refresh_days: คำนวณแถวของวันที่ระบุใหม่ด้วย aggregate ใน SQL (จาก pos/signals.py หลัง commit — รวมเป็นครั้งเดียว
+#     ต่อทรานแซกชัน) ล็อกวันก่อนคำนวณ (utils/day_rollup.py) — สองเครื่องคิดเงินที่ commit พร้อมกันต่อคิวกัน ไม่ชน unique
+#     การกระจายส่วนลดตามสัดส่วน subtotal ทำใน SQL ทั้งหมด — ไม่ดึงรายการขายมาที่ Python
+#   - rebuild: สร้างตารางสรุปใหม่ทั้งหมด (python manage.py rebuild_pos_sales)
+#   - period_totals / product_totals: ผลรวมของช่วงวันที่จากตารางสรุป (query ละหนึ่งครั้ง ไม่ขึ้นกับจำนวนคำสั่งซื้อ)
+
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
+
+from utils.day_rollup import lock
+
+COMPLETED = 'COMPLETED'
+_CENT = Decimal('0.01')
+
+
+def local_day(dt):
+    return timezone.localdate(dt) if timezone.is_aware(dt) else dt.date()
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def _in_days(days, field):
+    q = Q()
+    for day in days:
+        start, end = _day_range(day)
+        q |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+    return q
+
+
+def _order_rows(orders):
+    """(day, payment_method, จำนวน, ยอดสุทธิ, ส่วนลด) ต่อวัน × วิธีชำระเงิน"""
+    return (
+        orders.annotate(day=TruncDate('created_at'))
+        .values('day', 'payment_method')
+        .annotate(n=Count('id'), amount=Sum('total_amount'), disc=Sum('discount_amount'))
+        .values_list('day', 'payment_method', 'n', 'amount', 'disc')
+        .order_by()
+    )
+
+
+def _product_rows(orders):
+    """
+    (day, product_id, จำนวน, ยอดก่อนส่วนลด, ส่วนลดที่กระจายมา) ต่อวัน × สินค้า
+    ส่วนลดของรายการ = subtotal × ส่วนลดของ order ÷ subtotal รวมของ order
+    """
+    from .models import OrderItem
+
+    order_gross = (
+        OrderItem.objects.filter(order=OuterRef('order')).order_by()
+        .values('order').annotate(total=Sum('subtotal')).values('total')
+    )
+    return (
+        OrderItem.objects.filter(order__in=orders)
+        .annotate(
+            day=TruncDate('order__created_at'),
+            order_gross=Cast(Subquery(order_gross), FloatField()),
+        )
+        .annotate(share=Case(
+            When(order_gross__gt=0, then=(
+                Cast('subtotal', FloatField()) * Cast('order__discount_amount', FloatField()) / F('order_gross')
+            )),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ))
+        .values('day', 'product_id')
+        .annotate(qty=Sum('quantity'), gross=Sum('subtotal'), disc=Sum('share'))
+        .values_list('day', 'product_id', 'qty', 'gross', 'disc')
+        .order_by()
+    )
+
+
+def _write(orders, day_filter=None):
+    from .models import DailyProductSales, DailySalesSummary
+
+    # ล็อกวันก่อนอ่านยอด — ผลคำนวณรวมทุกคำสั่งซื้อที่ commit ก่อนได้ล็อก และไม่มีใครลบ / เขียนวันเดียวกันแทรก
+    with transaction.atomic():
+        if day_filter is not None:
+            lock('pos_sales', day_filter)
+        summaries = [
+            DailySalesSummary(
+                day=day, payment_method=method, order_count=n,
+                total_amount=amount or 0, discount_amount=disc or 0,
+            )
+            for day, method, n, amount, disc in _order_rows(orders)
+        ]
+        products = [
+            DailyProductSales(
+                day=day, product_id=product_id, quantity=qty or 0, gross=gross or 0,
+                discount=Decimal(str(disc or 0)).quantize(_CENT),
+            )
+            for day, product_id, qty, gross, disc in _product_rows(orders)
+        ]
+        if day_filter is None:
+            DailySalesSummary.objects.all().delete()
+            DailyProductSales.objects.all().delete()
+        else:
+            DailySalesSummary.objects.filter(day__in=day_filter).delete()
+            DailyProductSales.objects.filter(day__in=day_filter).delete()
+        DailySalesSummary.objects.bulk_create(summaries, batch_size=1000)
+        DailyProductSales.objects.bulk_create(products, batch_size=1000)
+    return len(summaries) + len(products)
+
+
+def refresh_days(days):
+    """คำนวณแถวสรุปของวันที่ระบุใหม่ทั้งหมดจาก Order / OrderItem"""
+    from .models import Order
+
+    days = {day for day in days if day}
+    if not days:
+        return
+    _write(Order.objects.filter(_in_days(days, 'created_at'), status=COMPLETED), days)
+
+
+def rebuild():
+    """สร้างตารางสรุปใหม่ทั้งหมด — Returns: จำนวนแถวสรุป"""
+    from .models import Order
+
+    return _write(Order.objects.filter(status=COMPLETED))
+
+
+def period_totals(start, end):
+    """{'sales', 'cash', 'qr', 'discount'} ของช่วงวันที่ (รวมทั้งสองวัน)"""
+    from .models import DailySalesSummary
+
+    totals = {'sales': Decimal('0'), 'cash': Decimal('0'), 'qr': Decimal('0'), 'discount': Decimal('0')}
+    rows = (
+        DailySalesSummary.objects.filter(day__range=(start, end))
+        .values('payment_method')
+        .annotate(amount=Sum('total_amount'), disc=Sum('discount_amount'))
+        .values_list('payment_method', 'amount', 'disc')
+        .order_by()
+    )
+    for method, amount, disc in rows:
+        totals['sales'] += amount or 0
+        totals['discount'] += disc or 0
+        if method == 'CASH':
+            totals['cash'] += amount or 0
+        elif method == 'QR':
+            totals['qr'] += amount or 0
+    return totals
+
+
+def product_totals(start, end):
+    """{product_id: (จำนวนที่ขาย, ยอดก่อนส่วนลด, ส่วนลด)} ของช่วงวันที่"""
+    from .models import DailyProductSales
+
+    rows = (
+        DailyProductSales.objects.filter(day__range=(start, end))
+        .values('product_id')
+        .annotate(qty=Sum('quantity'), gross=Sum('gross'), disc=Sum('discount'))
+        .values_list('product_id', 'qty', 'gross', 'disc')
+        .order_by()
+    )
+    return {product_id: (qty or 0, gross or 0, disc or 0) for product_id, qty, gross, disc in rows}
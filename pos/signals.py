@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+# ===== แคชราคาสินค้า (pos/catalog.py): สินค้าเปลี่ยน → ทุก process โหลดใหม่ในการคิดเงินครั้งถัดไป =====
+
+@receiver(post_save, sender='pos.Product')
+@receiver(post_delete, sender='pos.Product')
+def invalidate_catalog(sender, **kwargs):
+    from pos.catalog import invalidate
+
+    invalidate()
+
+
+# ===== ตารางสรุปยอดขายรายวัน (pos/sales_summary.py): คำนวณวันของคำสั่งซื้อใหม่หลัง commit =====
+# รอ commit เพื่อให้ OrderItem ที่ bulk_create ตามหลัง Order (api_process_order) ถูกนับด้วย
+# ทุก save ในทรานแซกชันเดียวกันรวมเป็นการคำนวณครั้งเดียว และคำนวณพลาดไม่ทำให้การคิดเงินที่ commit แล้วตอบ error
+
+def _refresh_on_commit(created_at):
+    from pos.sales_summary import local_day, refresh_days
+    from utils.day_rollup import on_commit
+
+    if created_at:
+        on_commit(refresh_days, {local_day(created_at)})
+
+
+@receiver(post_save, sender='pos.Order')
+@receiver(post_delete, sender='pos.Order')
+def refresh_sales_on_order(sender, instance, **kwargs):
+    _refresh_on_commit(instance.created_at)
+
+
+@receiver(post_save, sender='pos.OrderItem')
+@receiver(post_delete, sender='pos.OrderItem')
+def refresh_sales_on_item(sender, instance, **kwargs):
+    from pos.models import Order
+
+    created_at = Order.objects.filter(pk=instance.order_id).values_list('created_at', flat=True).first()
+    _refresh_on_commit(created_at)
@@ -1,3 +1,119 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import DailySalesSummary, Order, OrderItem, Product
+
+
+class _CheckoutTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser('cashier', 'cashier@example.com', 'pw')
+        cls.product = Product.objects.create(name='นมจืด', price=Decimal('20.00'), stock=5)
+
+    def setUp(self):
+        # login ส่ง signal ที่เปิด thread โหลดรายชื่อหุ้น (stocks/signals.py) — thread นั้นเขียน DB ชนกับเทส
+        patcher = mock.patch('stocks.signals.refresh_all_thai_symbols')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+
+    def _checkout(self, items, **extra):
+        return self.client.post(
+            reverse('pos:api_process_order'),
+            json.dumps(dict({'items': items, 'payment_method': 'CASH'}, **extra)),
+            content_type='application/json',
+        )
+
+
+class CheckoutTest(_CheckoutTestCase):
+    """การคิดเงินล็อกสต็อกทั้งตะกร้า: ขายเกินต้องยกเลิกทั้งคำสั่งซื้อ และจำนวน query ไม่ขึ้นกับขนาดตะกร้า"""
+
+    def test_oversell_rolls_back_order(self):
+        other = Product.objects.create(name='ขนมปัง', price=Decimal('15.00'), stock=10)
+        response = self._checkout([{'id': other.id, 'quantity': 2}, {'id': self.product.id, 'quantity': 6}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Not enough stock', response.json()['message'])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertEqual(Product.objects.get(pk=other.pk).stock, 10)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 5)
+
+    def test_duplicate_lines_share_one_stock_check(self):
+        # แต่ละบรรทัดไม่เกินสต็อก แต่รวมกันเกิน → ต้องไม่ผ่าน
+        response = self._checkout([{'id': self.product.id, 'quantity': 3}, {'id': self.product.id, 'quantity': 3}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 5)
+
+        response = self._checkout([{'id': self.product.id, 'quantity': 2}, {'id': self.product.id, 'quantity': 3}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 0)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.json()['order_id']).count(), 2)
+
+    def test_inactive_and_missing_products_skipped(self):
+        hidden = Product.objects.create(name='เลิกขาย', price=Decimal('99.00'), stock=3, is_active=False)
+        missing = Product.objects.order_by('-pk').values_list('pk', flat=True).first() + 1000
+        response = self._checkout([
+            {'id': hidden.id, 'quantity': 1}, {'id': missing, 'quantity': 1}, {'id': self.product.id, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total'], 20.0)
+        self.assertEqual(list(OrderItem.objects.values_list('product_id', flat=True)), [self.product.id])
+        self.assertEqual(Product.objects.get(pk=hidden.pk).stock, 3)
+
+        response = self._checkout([{'id': hidden.id, 'quantity': 1}, {'id': missing, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_query_count_independent_of_cart_size(self):
+        products = [Product.objects.create(name=f'สินค้า {i}', price=Decimal('10.00'), stock=100) for i in range(30)]
+        self._checkout([{'id': products[0].id, 'quantity': 1}])  # โหลดแคชราคาก่อน
+
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self._checkout([{'id': products[0].id, 'quantity': 1}]).status_code, 200)
+        with self.assertNumQueries(len(small.captured_queries)):
+            response = self._checkout([{'id': p.id, 'quantity': 2} for p in products])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OrderItem.objects.filter(order_id=response.json()['order_id']).count(), 30)
+        self.assertEqual(set(Product.objects.filter(pk__in=[p.pk for p in products[1:]]).values_list('stock', flat=True)), {98})
+
+
+class SalesSummaryRefreshTest(_CheckoutTestCase):
+    """ตารางสรุปยอดขายคำนวณหลัง commit ครั้งเดียวต่อทรานแซกชัน และคำนวณพลาดต้องไม่ทำให้การคิดเงินตอบ error"""
+
+    def test_checkout_updates_summary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._checkout([{'id': self.product.id, 'quantity': 2}], discount=5)
+        self.assertEqual(response.status_code, 200)
+        row = DailySalesSummary.objects.get(day=timezone.localdate(), payment_method='CASH')
+        self.assertEqual((row.order_count, row.total_amount, row.discount_amount), (1, Decimal('35.00'), Decimal('5.00')))
+
+    def test_failed_refresh_does_not_fail_committed_sale(self):
+        with mock.patch('pos.sales_summary.refresh_days', side_effect=RuntimeError('boom')):
+            with self.assertLogs('django', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+                response = self._checkout([{'id': self.product.id, 'quantity': 2}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
 
-# Create your tests here.
+    def test_refreshes_coalesce_per_transaction(self):
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        with mock.patch('pos.sales_summary.refresh_days') as refresh_days:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with transaction.atomic():
+                    for created_at in (timezone.now(), timezone.now(), yesterday):
+                        order = Order.objects.create(total_amount=10, status='COMPLETED')
+                        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+                        order.created_at = created_at
+                        order.save()
+        self.assertEqual(len(callbacks), 1)
+        refresh_days.assert_called_once_with({timezone.localdate(), timezone.localdate(yesterday)})
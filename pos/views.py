@@ -111,11 +111,15 @@ def api_process_order(request):
     JSON API: ประมวลผลการชำระเงินและสร้างคำสั่งซื้อ
     ขั้นตอน:
     1. รับข้อมูลสินค้า จำนวน วิธีชำระเงิน และส่วนลดจาก request body (JSON)
-    2. ใช้ transaction.atomic() เพื่อให้การบันทึกทั้งหมดสำเร็จหรือล้มเหลวพร้อมกัน
-    3. สร้าง Order และ OrderItem แต่ละรายการ
-    4. ตัดสต็อกสินค้าตามจำนวนที่ขาย
-    5. คำนวณยอดรวมสุทธิหลังหักส่วนลด
+    2. คิดราคาจากแคชราคาสินค้า (pos/catalog.py) — ข้ามสินค้าที่ไม่พบหรือปิดการขาย
+    3. ใช้ transaction.atomic() + select_for_update ล็อกแถวสินค้าทั้งตะกร้าใน query เดียว
+       (สองเครื่องคิดเงินพร้อมกันจะรอกัน ไม่ขายเกินสต็อก) — สต็อกไม่พอจะยกเลิกทั้งคำสั่งซื้อ
+    4. สร้าง Order และ OrderItem ทั้งหมดด้วย bulk_create
+    5. ตัดสต็อกด้วย F('stock') - จำนวน ผ่าน bulk_update
+    จำนวน query คงที่ไม่ขึ้นกับจำนวนรายการในตะกร้า
     """
+    from .catalog import get_catalog
+
     try:
         # แปลง JSON body เป็น Python dict
         data = json.loads(request.body)
@@ -127,49 +131,74 @@ def api_process_order(request):
         if not items:
             return JsonResponse({'status': 'error', 'message': 'No items in order'}, status=400)
 
+        # คิดราคาจากแคช — ราคา ณ เวลาขาย
+        catalog = get_catalog()
+        lines = []
+        for item in items:
+            entry = catalog.get(int(item['id']))
+            if entry is None or not entry[1]:
+                # ข้ามสินค้าที่ไม่พบในระบบ หรือปิดการขายแล้ว
+                continue
+
+            quantity = int(item['quantity'])
+            if quantity <= 0: continue  # ข้ามรายการที่มีจำนวนเป็น 0 หรือติดลบ
+
+            price = entry[0]
+            lines.append((int(item['id']), quantity, price, price * quantity))
+
+        if not lines:
+            return JsonResponse({'status': 'error', 'message': 'No items in order'}, status=400)
+
+        # จำนวนที่ต้องตัดสต็อกรวมต่อสินค้า (ตะกร้าอาจมีสินค้าเดียวกันหลายบรรทัด)
+        sold = {}
+        for product_id, quantity, _, _ in lines:
+            sold[product_id] = sold.get(product_id, 0) + quantity
+
+        total = sum(subtotal for _, _, _, subtotal in lines)
+        # คำนวณยอดรวมสุทธิ: ไม่ให้ติดลบ (min = 0)
+        final_total = max(0, float(total) - discount)
+
         # ใช้ atomic transaction เพื่อป้องกันข้อมูลไม่สมบูรณ์หากเกิดข้อผิดพลาดระหว่างทาง
         with transaction.atomic():
+            # ====== การจัดการสต็อก: ล็อกแถวสินค้าทั้งตะกร้า แล้วตรวจว่าสต็อกพอ ======
+            locked = {
+                p.id: p for p in
+                Product.objects.select_for_update().filter(id__in=sold).only('id', 'name', 'stock')
+            }
+            for product_id, quantity in sold.items():
+                product = locked.get(product_id)
+                if product is None:
+                    raise ValueError('Product not found')
+                if product.stock < quantity:
+                    raise ValueError(f'Not enough stock: {product.name} (เหลือ {product.stock})')
+
             # สร้างคำสั่งซื้อใหม่ (สถานะ COMPLETED ทันที เนื่องจาก POS ชำระเงินสด)
             order = Order.objects.create(
                 payment_method=payment_method,
                 status='COMPLETED',
-                discount_amount=discount
+                discount_amount=discount,
+                total_amount=final_total,
             )
 
-            total = 0
-            for item in items:
-                try:
-                    product = Product.objects.get(id=item['id'])
-                except Product.DoesNotExist:
-                    # ข้ามสินค้าที่ไม่พบในระบบ
-                    continue
-
-                quantity = int(item['quantity'])
-                if quantity <= 0: continue  # ข้ามรายการที่มีจำนวนเป็น 0 หรือติดลบ
-
-                price = product.price  # ใช้ราคาปัจจุบันของสินค้า ณ เวลาขาย
-                subtotal = price * quantity
-
-                # สร้างรายการสินค้าในคำสั่งซื้อ (OrderItem)
-                OrderItem.objects.create(
+            # สร้างรายการสินค้าในคำสั่งซื้อ (OrderItem) ทั้งหมดใน query เดียว
+            OrderItem.objects.bulk_create([
+                OrderItem(
                     order=order,
-                    product=product,
+                    product_id=product_id,
                     quantity=quantity,
                     price=price,
                     subtotal=subtotal
                 )
+                for product_id, quantity, price, subtotal in lines
+            ])
 
-                # ====== การจัดการสต็อก: ตัดสต็อกตามจำนวนที่ขาย ======
-                product.stock -= quantity
-                product.save()
-
-                total += subtotal
-
-            # คำนวณยอดรวมสุทธิ: ไม่ให้ติดลบ (min = 0)
-            # Apply Discount to Total
-            final_total = max(0, float(total) - discount)
-            order.total_amount = final_total
-            order.save()
+            # ตัดสต็อกตามจำนวนที่ขาย (UPDATE ... CASE เดียว)
+            now = timezone.now()
+            for product_id, quantity in sold.items():
+                product = locked[product_id]
+                product.stock = F('stock') - quantity
+                product.updated_at = now
+            Product.objects.bulk_update(locked.values(), ['stock', 'updated_at'])
 
         # คืนค่าสำเร็จพร้อม order_id และยอดรวม
         return JsonResponse({
@@ -236,6 +265,13 @@ def api_category_delete(request, pk):
 
 # ====== รายงานยอดขายและสต็อก ======
 
+def _active_product_rows():
+    """สินค้า active ทั้งหมด (เฉพาะคอลัมน์ที่รายงานใช้) เรียงตามชื่อ — อ่านทีละ chunk ไม่สร้าง model instance"""
+    return Product.objects.filter(is_active=True).order_by('name').values(
+        'id', 'name', 'code', 'category__name', 'price', 'stock'
+    ).iterator(chunk_size=2000)
+
+
 @login_required
 def api_sales_report(request):
     """
@@ -273,6 +309,8 @@ def api_sales_report(request):
         start_date = today
         end_date = today
 
+    from .sales_summary import period_totals, product_totals
+
     # กรองเฉพาะคำสั่งซื้อที่สถานะ COMPLETED ในช่วงวันที่กำหนด
     # Filter completed orders within range
     # created_at is DateTime, so we filter by date range
@@ -282,13 +320,9 @@ def api_sales_report(request):
         created_at__date__lte=end_date
     )
 
-    # คำนวณยอดขายรวมสุทธิ
-    total_sales = orders_qs.aggregate(sum=Sum('total_amount'))['sum'] or 0
-
-    # แยกยอดขายตามวิธีชำระเงิน
-    # Payment method breakdown
-    cash_sales = orders_qs.filter(payment_method='CASH').aggregate(sum=Sum('total_amount'))['sum'] or 0
-    qr_sales = orders_qs.filter(payment_method='QR').aggregate(sum=Sum('total_amount'))['sum'] or 0
+    # ยอดขายรวมสุทธิ แยกตามวิธีชำระเงิน และส่วนลดรวม — อ่านจากตารางสรุปรายวัน (pos/sales_summary.py)
+    # Totals + payment method breakdown from the daily summary table
+    totals = period_totals(start_date, end_date)
 
     # มูลค่าสต็อกสินค้าปัจจุบัน (ราคา × จำนวน)
     # Stock info (Always current)
@@ -322,68 +356,31 @@ def api_sales_report(request):
 
     # ====== คำนวณประสิทธิภาพการขายแยกตามสินค้า ======
     # Product Performance (Detailed)
-    # 1. ดึงสินค้า active ทั้งหมด พร้อมข้อมูลหมวดหมู่
-    # 1. Get all active products
-    all_products = Product.objects.filter(is_active=True).select_related('category')
-
-    # 2. คำนวณสถิติการขาย โดยกระจายส่วนลดตามสัดส่วนยอดขายของแต่ละสินค้า (prorated discount)
-    # 2. Calculate sales stats with prorated discount
-    # We iterate over orders to distribute discount
-    from collections import defaultdict
-    product_stats = defaultdict(lambda: {'qty': 0, 'subtotal': 0, 'discount': 0})
-
-    # prefetch_related เพื่อลดจำนวน query ในการดึง items ของแต่ละ order
-    orders = orders_qs.prefetch_related('items', 'items__product')
-
-    for order in orders:
-        items = order.items.all()
-        # คำนวณยอดรวมก่อนส่วนลดของ order นี้
-        # Calculate order subtotal sum (pre-discount)
-        order_subtotal_sum = sum(item.subtotal for item in items)
-
-        # คำนวณอัตราส่วนของส่วนลดเทียบกับยอดรวม เพื่อกระจายส่วนลดตามสัดส่วน
-        discount_ratio = 0
-        if order_subtotal_sum > 0:
-            discount_ratio = float(order.discount_amount) / float(order_subtotal_sum)
-
-        for item in items:
-            # ส่วนลดที่ควรได้รับของสินค้านี้ = subtotal × อัตราส่วนส่วนลด
-            item_discount = float(item.subtotal) * discount_ratio
-            product_stats[item.product_id]['qty'] += item.quantity
-            product_stats[item.product_id]['subtotal'] += float(item.subtotal)
-            product_stats[item.product_id]['discount'] += item_discount
-
-    # สร้าง list ประสิทธิภาพการขายแต่ละสินค้า
+    # ยอดขาย/ส่วนลดที่กระจายตามสัดส่วน (prorated discount) ต่อสินค้า คำนวณใน SQL ไว้แล้วในตารางสรุป
+    product_stats = product_totals(start_date, end_date)
     product_performance = []
-    for p in all_products:
-        stat = product_stats[p.id]
-        revenue = stat['subtotal']      # ยอดขายรวม (ก่อนส่วนลด)
-        discount = stat['discount']     # ส่วนลดที่ได้รับ
-        net_sale = revenue - discount   # ยอดขายสุทธิ
+    for p in _active_product_rows():
+        qty, revenue, discount = product_stats.get(p['id'], (0, 0, 0))
 
         product_performance.append({
-            'name': p.name,
-            'code': p.code or '-',
-            'category': p.category.name if p.category else 'Uncategorized',
-            'price': float(p.price),
-            'stock': p.stock,
-            'sold_qty': stat['qty'],        # จำนวนที่ขายได้
-            'gross_revenue': revenue,        # รายได้รวมก่อนส่วนลด
-            'discount': discount,            # ส่วนลดที่ให้
-            'net_sale': net_sale             # รายได้สุทธิหลังส่วนลด
+            'name': p['name'],
+            'code': p['code'] or '-',
+            'category': p['category__name'] or 'Uncategorized',
+            'price': float(p['price']),
+            'stock': p['stock'],
+            'sold_qty': qty,                           # จำนวนที่ขายได้
+            'gross_revenue': float(revenue),           # รายได้รวมก่อนส่วนลด
+            'discount': float(discount),               # ส่วนลดที่ให้
+            'net_sale': float(revenue - discount)      # รายได้สุทธิหลังส่วนลด
         })
 
-    # ยอดส่วนลดรวมทั้งหมดในช่วงวันที่กำหนด
-    # Discount
-    total_discount = orders_qs.aggregate(sum=Sum('discount_amount'))['sum'] or 0
-
     return JsonResponse({
         'status': 'success',
         'data': {
-            'sales_amount': float(total_sales),          # ยอดขายสุทธิรวม
-            'cash_sales': float(cash_sales),             # ยอดขายเงินสด
-            'qr_sales': float(qr_sales),                 # ยอดขาย QR
-            'total_discount': float(total_discount),     # ส่วนลดรวม
+            'sales_amount': float(totals['sales']),      # ยอดขายสุทธิรวม
+            'cash_sales': float(totals['cash']),         # ยอดขายเงินสด
+            'qr_sales': float(totals['qr']),             # ยอดขาย QR
+            'total_discount': float(totals['discount']), # ส่วนลดรวม
             'stock_value': float(stock_value),           # มูลค่าสต็อกปัจจุบัน
             'low_stock': low_stock,                      # สินค้าสต็อกต่ำ
             'recent_orders': recent_orders,              # คำสั่งซื้อล่าสุด
@@ -406,7 +403,8 @@ def export_sales_csv(request):
     ไฟล์ CSV มี BOM (Byte Order Mark) เพื่อให้ Excel เปิดภาษาไทยได้ถูกต้อง
     """
     import csv
-    from django.http import HttpResponse
+    from django.http import StreamingHttpResponse
+    from .sales_summary import period_totals, product_totals
 
     today = timezone.now().date()
     start_date = request.GET.get('start_date')
@@ -426,88 +424,53 @@ def export_sales_csv(request):
         start_date = today
         end_date = today
 
-    # ตั้งค่า response เป็นไฟล์ CSV พร้อมชื่อไฟล์ที่มีช่วงวันที่
-    response = HttpResponse(content_type='text/csv')
+    def rows():
+        # หัวรายงาน: แสดงช่วงวันที่
+        yield ['Period', f'{start_date} to {end_date}']
+        yield []
+
+        # ====== ส่วนสรุปยอดขาย ======
+        # Summary
+        totals = period_totals(start_date, end_date)
+        yield ['Total Sales', totals['sales']]
+        yield ['Total Discount', totals['discount']]
+        yield ['Total Cash Get', totals['cash']]
+        yield ['QR Sales', totals['qr']]
+        yield []
+
+        # ====== ส่วนรายละเอียดสินค้าแยกตามชนิด ======
+        # Product Details — ส่วนลดกระจายตามสัดส่วน (prorated) เช่นเดียวกับ api_sales_report
+        yield ['Product Name', 'Code', 'Category', 'Current Price', 'Current Stock', 'Sold Qty', 'Gross Revenue', 'Discount', 'Net Sale']
+        product_stats = product_totals(start_date, end_date)
+        for p in _active_product_rows():
+            qty, revenue, discount = product_stats.get(p['id'], (0, 0, 0))
+            yield [
+                p['name'],
+                p['code'] or '-',
+                p['category__name'] or 'Uncategorized',
+                p['price'],
+                p['stock'],
+                qty,
+                f"{revenue:.2f}",
+                f"{discount:.2f}",
+                f"{revenue - discount:.2f}"
+            ]
+
+    class _Echo:
+        # csv.writer เขียนลง object นี้แล้วคืนบรรทัดกลับมา — ส่งออกทีละบรรทัดโดยไม่ต้องเก็บทั้งไฟล์ในหน่วยความจำ
+        def write(self, value):
+            return value
+
+    writer = csv.writer(_Echo())
+
+    def stream():
+        # เพิ่ม BOM เพื่อให้ Excel เปิดไฟล์ UTF-8 ได้ถูกต้อง
+        # BOM for Excel to open UTF-8 correctly
+        yield '\ufeff'
+        for row in rows():
+            yield writer.writerow(row)
+
+    # ตั้งค่า response เป็นไฟล์ CSV (stream) พร้อมชื่อไฟล์ที่มีช่วงวันที่
+    response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
     response['Content-Disposition'] = f'attachment; filename="sales_report_{start_date}_{end_date}.csv"'
-
-    # เพิ่ม BOM เพื่อให้ Excel เปิดไฟล์ UTF-8 ได้ถูกต้อง
-    # BOM for Excel to open UTF-8 correctly
-    response.write(u'\ufeff'.encode('utf8'))
-
-    writer = csv.writer(response)
-    # หัวรายงาน: แสดงช่วงวันที่
-    writer.writerow(['Period', f'{start_date} to {end_date}'])
-    writer.writerow([])
-
-    # ====== ส่วนสรุปยอดขาย ======
-    # Summary
-    orders_qs = Order.objects.filter(
-        status='COMPLETED',
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date
-    )
-    total_sales = orders_qs.aggregate(sum=Sum('total_amount'))['sum'] or 0
-    total_discount = orders_qs.aggregate(sum=Sum('discount_amount'))['sum'] or 0
-    cash_sales = orders_qs.filter(payment_method='CASH').aggregate(sum=Sum('total_amount'))['sum'] or 0
-    qr_sales = orders_qs.filter(payment_method='QR').aggregate(sum=Sum('total_amount'))['sum'] or 0
-
-    # เขียนข้อมูลสรุปลง CSV
-    writer.writerow(['Total Sales', total_sales])
-    writer.writerow(['Total Discount', total_discount])
-    writer.writerow(['Total Cash Get', cash_sales])
-    writer.writerow(['QR Sales', qr_sales])
-    writer.writerow([])
-
-    # ====== ส่วนรายละเอียดสินค้าแยกตามชนิด ======
-    # Product Details
-    writer.writerow(['Product Name', 'Code', 'Category', 'Current Price', 'Current Stock', 'Sold Qty', 'Gross Revenue', 'Discount', 'Net Sale'])
-
-    # กระจายส่วนลดตามสัดส่วน (Prorated Discount) เช่นเดียวกับ api_sales_report
-    # Prorate discounts
-    from collections import defaultdict
-    product_stats = defaultdict(lambda: {'qty': 0, 'subtotal': 0, 'discount': 0})
-
-    all_orders = Order.objects.filter(
-        status='COMPLETED',
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date
-    ).prefetch_related('items') # Note: items__product prefetched implicitly or can be added if needed, but here we just need item data
-
-    for order in all_orders:
-        items = order.items.all()
-        # คำนวณยอดก่อนส่วนลดของ order นี้
-        order_subtotal_sum = sum(item.subtotal for item in items)
-
-        discount_ratio = 0
-        if order_subtotal_sum > 0:
-            discount_ratio = float(order.discount_amount) / float(order_subtotal_sum)
-
-        for item in items:
-            # คำนวณส่วนลดตามสัดส่วนของสินค้านี้
-            item_discount = float(item.subtotal) * discount_ratio
-            product_stats[item.product_id]['qty'] += item.quantity
-            product_stats[item.product_id]['subtotal'] += float(item.subtotal)
-            product_stats[item.product_id]['discount'] += item_discount
-
-    # เขียนข้อมูลสินค้าแต่ละชนิดลง CSV เรียงตามชื่อสินค้า
-    products = Product.objects.filter(is_active=True).select_related('category').order_by('name')
-
-    for p in products:
-        stat = product_stats[p.id]
-        revenue = stat['subtotal']       # ยอดขายรวมก่อนส่วนลด
-        discount = stat['discount']      # ส่วนลดที่กระจายมา
-        net_sale = revenue - discount    # ยอดขายสุทธิ
-
-        writer.writerow([
-            p.name,
-            p.code or '-',
-            p.category.name if p.category else 'Uncategorized',
-            p.price,
-            p.stock,
-            stat['qty'],
-            f"{revenue:.2f}",
-            f"{discount:.2f}",
-            f"{net_sale:.2f}"
-        ])
-
     return response
@@ -0,0 +1,129 @@
+# ====== analytics.py — ตารางสรุปรายวัน (RepairDailyStat) สำหรับ Dashboard / รายงานรายได้ ======
+# เดิม dashboard วนทุกช่าง × ทุกประเภทงาน ยิง count() / aggregate(Sum) หลายครั้งต่อคู่ และนับรายการรับเข้า
+# ทีละวันสำหรับกราฟ — หลายร้อย query ต่อการเปิดหน้าเดียว
+#
+# โมดูลนี้:
+#   - refresh_days: คำนวณแถวสรุปของวันที่ระบุใหม่จาก RepairItem จริง (เรียกจาก signal เมื่อรายการถูกบันทึก/ลบ/เปลี่ยนช่าง)
+#     คำนวณใหม่ทั้งวันแทนการบวก/ลบทีละ event — ตารางสรุปไม่มีทางเพี้ยนสะสม และหนึ่งวันมีรายการไม่มาก
+#   - rebuild: สร้างตารางสรุปใหม่ทั้งหมด (python manage.py backfill_repair_stats)
+#   - local_day: วันที่ตามเวลาท้องถิ่นของ datetime (ตรงกับ created_at__date / updated_at__range ของ view เดิม)
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from utils.day_rollup import lock
+
+# สถานะที่ถือว่าปิดงานแล้ว (ไม่นับเป็นงานค้าง)
+CLOSED_STATUSES = ['FINISHED', 'CANCELLED', 'COMPLETED']
+# รวมทุกช่าง / ไม่ระบุประเภทงาน
+ALL_TECHNICIANS = 0
+NO_REPAIR_TYPE = 0
+
+
+def local_day(dt):
+    return timezone.localdate(dt) if timezone.is_aware(dt) else dt.date()
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def _aggregate(rows, tech_map, days):
+    """
+    rows: (pk, status, created_at, updated_at, final_cost, repair_type_id) ของ RepairItem
+    Returns: {(day, technician_id, repair_type_id, status): [received, items, income]} เฉพาะวันใน days
+    """
+    buckets = defaultdict(lambda: [0, 0, Decimal('0')])
+    for pk, status, created_at, updated_at, final_cost, repair_type_id in rows:
+        created_day, updated_day = local_day(created_at), local_day(updated_at)
+        repair_type_id = repair_type_id or NO_REPAIR_TYPE
+        for tech_id in [ALL_TECHNICIANS] + tech_map.get(pk, []):
+            if days is None or created_day in days:
+                buckets[(created_day, tech_id, repair_type_id, status)][0] += 1
+            if days is None or updated_day in days:
+                bucket = buckets[(updated_day, tech_id, repair_type_id, status)]
+                bucket[1] += 1
+                bucket[2] += final_cost or Decimal('0')
+    return buckets
+
+
+def _technician_map(item_ids):
+    from .models import RepairItem
+
+    tech_map = defaultdict(list)
+    rows = RepairItem.technicians.through.objects.filter(repairitem_id__in=item_ids).values_list(
+        'repairitem_id', 'technician_id'
+    )
+    for item_id, tech_id in rows:
+        tech_map[item_id].append(tech_id)
+    return tech_map
+
+
+def _item_rows(queryset):
+    return list(queryset.values_list(
+        'pk', 'status', 'created_at', 'updated_at', 'final_cost', 'job__repair_type_id'
+    ))
+
+
+def _write(buckets):
+    from .models import RepairDailyStat
+
+    RepairDailyStat.objects.bulk_create(
+        [
+            RepairDailyStat(
+                day=day, technician_id=tech_id, repair_type_id=type_id, status=status,
+                received=received, items=items, income=income,
+            )
+            for (day, tech_id, type_id, status), (received, items, income) in buckets.items()
+        ],
+        batch_size=1000,
+    )
+
+
+def refresh_days(days):
+    """
+    คำนวณแถวสรุปของวันที่ระบุใหม่ทั้งหมด (รายการที่รับเข้า หรือแก้ไขล่าสุด ในวันเหล่านั้น)
+    ล็อกวันก่อนอ่านรายการ — สองทรานแซกชันที่คำนวณวันเดียวกันต่อคิวกัน ไม่ลบ / bulk_create แทรกกันจนชน unique
+    """
+    from .models import RepairDailyStat, RepairItem
+
+    days = {day for day in days if day}
+    if not days:
+        return
+    in_days = Q()
+    for day in days:
+        start, end = _day_range(day)
+        in_days |= Q(created_at__gte=start, created_at__lt=end) | Q(updated_at__gte=start, updated_at__lt=end)
+
+    with transaction.atomic():
+        lock('repairs_stats', days)
+        rows = _item_rows(RepairItem.objects.filter(in_days))
+        buckets = _aggregate(rows, _technician_map([row[0] for row in rows]), days)
+        RepairDailyStat.objects.filter(day__in=days).delete()
+        _write(buckets)
+
+
+def rebuild(chunk_size=2000):
+    """สร้างตารางสรุปใหม่ทั้งหมดจาก RepairItem — Returns: จำนวนแถวสรุป"""
+    from .models import RepairDailyStat, RepairItem
+
+    buckets = defaultdict(lambda: [0, 0, Decimal('0')])
+    ids = list(RepairItem.objects.order_by('pk').values_list('pk', flat=True))
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        rows = _item_rows(RepairItem.objects.filter(pk__in=chunk))
+        for key, (received, items, income) in _aggregate(rows, _technician_map(chunk), None).items():
+            bucket = buckets[key]
+            bucket[0] += received
+            bucket[1] += items
+            bucket[2] += income
+    with transaction.atomic():
+        RepairDailyStat.objects.all().delete()
+        _write(buckets)
+    return len(buckets)
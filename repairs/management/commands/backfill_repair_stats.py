@@ -0,0 +1,17 @@
+"""
+python manage.py backfill_repair_stats
+
+สร้างตารางสรุป RepairDailyStat ใหม่ทั้งหมดจาก RepairItem (repairs/analytics.py)
+รันครั้งแรกหลัง migrate — หลังจากนั้นตารางถูกอัปเดตเองทุกครั้งที่รายการซ่อมถูกบันทึก
+"""
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'สร้างตารางสรุปรายวันของงานซ่อม (RepairDailyStat) ใหม่ทั้งหมด'
+
+    def handle(self, *args, **options):
+        from repairs.analytics import rebuild
+
+        rows = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'RepairDailyStat: {rows} แถว'))
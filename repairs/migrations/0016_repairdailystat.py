@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-17 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repairs', '0015_alter_repairitem_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepairDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('technician_id', models.PositiveIntegerField(default=0)),
+                ('repair_type_id', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(max_length=50)),
+                ('received', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name_plural': 'Repair Daily Stats',
+                'indexes': [models.Index(fields=['status', 'technician_id'], name='repairs_rep_status_f4901b_idx')],
+                'unique_together': {('day', 'technician_id', 'repair_type_id', 'status')},
+            },
+        ),
+    ]
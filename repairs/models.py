@@ -145,6 +145,11 @@ class RepairJob(models.Model):
     created_at = models.DateTimeField(default=timezone.now)   # วันที่รับงาน
     updated_at = models.DateTimeField(auto_now=True)          # วันที่แก้ไขล่าสุด
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ประเภทงานตอนโหลดจาก DB — เปลี่ยนประเภทแล้วต้องคำนวณ RepairDailyStat ของรายการในใบงานใหม่
+        self._old_repair_type_id = self.repair_type_id
+
     def save(self, *args, **kwargs):
         """สร้างรหัสงานอัตโนมัติหากยังไม่มี โดยใช้วันที่ปัจจุบันและลำดับรันนิ่ง"""
         if not self.job_code:
@@ -256,6 +261,11 @@ class RepairItem(models.Model):
     updated_at = models.DateTimeField(auto_now=True)           # วันที่แก้ไขล่าสุด
     closed_at = models.DateTimeField(null=True, blank=True, verbose_name="วันที่ซ่อมเสร็จ/คืนเครื่อง")  # วันที่ปิดงาน
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # updated_at ตอนโหลดจาก DB — signal ใช้หาวันเดิมใน RepairDailyStat ที่ต้องคำนวณใหม่
+        self._old_updated_at = self.updated_at
+
     def get_status_color(self):
         """คืนค่า HEX Color จากสถานะใหม่ใน DB หรือ fallback เป็นค่าเดิม"""
         if self.current_status:
@@ -391,3 +401,34 @@ class RepairStatusHistory(models.Model):
     class Meta:
         ordering = ['-changed_at']          # เรียงจากใหม่ไปเก่า
         verbose_name_plural = "Repair Status Histories"
+
+
+# ====== RepairDailyStat — ตารางสรุปรายวันสำหรับ Dashboard ======
+
+class RepairDailyStat(models.Model):
+    """สรุปรายการซ่อมรายวัน แยกตาม ช่าง × ประเภทงาน × สถานะปัจจุบัน (repairs/analytics.py)
+
+    - received : จำนวนรายการที่รับเข้า (created_at) ในวันนั้น
+    - items    : จำนวนรายการที่แก้ไขล่าสุด (updated_at) ในวันนั้น
+    - income   : final_cost รวมของ items
+    - technician_id = 0 คือแถวรวมทุกรายการ (รายการที่มีช่างหลายคนนับครั้งเดียว)
+    - repair_type_id = 0 คือใบงานที่ไม่ระบุประเภท
+
+    อัปเดตอัตโนมัติเมื่อ RepairItem ถูกบันทึก/ลบ/เปลี่ยนช่าง (repairs/signals.py)
+    สร้างใหม่ทั้งหมด: python manage.py backfill_repair_stats
+    """
+    day = models.DateField()
+    technician_id = models.PositiveIntegerField(default=0)
+    repair_type_id = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=50)
+    received = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('day', 'technician_id', 'repair_type_id', 'status')
+        indexes = [models.Index(fields=['status', 'technician_id'])]
+        verbose_name_plural = "Repair Daily Stats"
+
+    def __str__(self):
+        return f"{self.day} tech={self.technician_id} type={self.repair_type_id} {self.status}"
@@ -0,0 +1,63 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+
+# ===== RepairDailyStat: คำนวณแถวสรุปของวันที่รายการซ่อมเกี่ยวข้องใหม่ =====
+
+def _item_days(item, *extra):
+    from repairs.analytics import local_day
+    return {local_day(dt) for dt in (item.created_at, item.updated_at, *extra) if dt}
+
+
+@receiver(post_save, sender='repairs.RepairItem')
+def refresh_stats_on_item_save(sender, instance, **kwargs):
+    """บันทึกรายการ → วันที่รับเข้า + วันที่แก้ไขล่าสุด (เดิมและใหม่)"""
+    from repairs.analytics import refresh_days
+
+    refresh_days(_item_days(instance, instance._old_updated_at))
+    instance._old_updated_at = instance.updated_at
+
+
+@receiver(post_delete, sender='repairs.RepairItem')
+def refresh_stats_on_item_delete(sender, instance, **kwargs):
+    from repairs.analytics import refresh_days
+
+    refresh_days(_item_days(instance))
+
+
+@receiver(m2m_changed, sender='repairs.RepairItem_technicians')
+def refresh_stats_on_technicians(sender, instance, action, reverse, pk_set, **kwargs):
+    """เพิ่ม/ถอดช่างจากรายการ (item.technicians หรือ technician.repairitem_set)"""
+    from repairs.analytics import refresh_days
+    from repairs.models import RepairItem
+
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_days(_item_days(instance))
+        return
+
+    # instance คือ Technician, pk_set คือ RepairItem — หลัง clear จะไม่รู้แล้วว่าเคยมีรายการไหน เก็บไว้ก่อน
+    if action == 'pre_clear':
+        instance._cleared_item_ids = set(instance.repairitem_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    item_ids = getattr(instance, '_cleared_item_ids', set()) if action == 'post_clear' else (pk_set or set())
+    days = set()
+    for item in RepairItem.objects.filter(pk__in=item_ids).only('created_at', 'updated_at'):
+        days |= _item_days(item)
+    refresh_days(days)
+
+
+@receiver(post_save, sender='repairs.RepairJob')
+def refresh_stats_on_repair_type(sender, instance, created, **kwargs):
+    """เปลี่ยนประเภทงานของใบงาน → วันที่ของทุกรายการในใบงาน"""
+    from repairs.analytics import refresh_days
+
+    if created or instance._old_repair_type_id == instance.repair_type_id:
+        return
+    instance._old_repair_type_id = instance.repair_type_id
+    days = set()
+    for item in instance.items.only('created_at', 'updated_at'):
+        days |= _item_days(item)
+    refresh_days(days)
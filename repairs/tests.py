@@ -1,7 +1,10 @@
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Customer, Device, RepairJob, RepairItem, Technician, Brand, DeviceType
+from decimal import Decimal
+from .models import Customer, Device, RepairJob, RepairItem, Technician, Brand, DeviceType, RepairType, RepairDailyStat
 
 class RepairSystemTest(TestCase):
     def setUp(self):
@@ -83,3 +86,70 @@ class RepairSystemTest(TestCase):
         self.assertEqual(response.status_code, 302)
         item.refresh_from_db()
         self.assertEqual(item.status, 'FIXING')
+
+
+class RepairDailyStatTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_superuser(username="admin", password="password")
+        self.client.login(username="admin", password="password")
+        self.tech_a = Technician.objects.create(name="Tech A")
+        self.tech_b = Technician.objects.create(name="Tech B")
+        self.repair_type = RepairType.objects.create(name="Walk-in")
+        brand = Brand.objects.create(name="Samsung")
+        device_type = DeviceType.objects.create(name="Mobile")
+        self.customer = Customer.objects.create(name="John Test", contact_number="0812345678")
+        self.job = RepairJob.objects.create(customer=self.customer, repair_type=self.repair_type)
+        self.device = Device.objects.create(customer=self.customer, brand=brand, model="Phone", device_type=device_type)
+
+    def _item(self, status, final_cost=None, technicians=()):
+        item = RepairItem.objects.create(
+            job=self.job, device=self.device, issue_description="Broken", status=status, final_cost=final_cost
+        )
+        item.technicians.set(technicians)
+        return item
+
+    def test_rollup_follows_item_changes(self):
+        """ตารางสรุปตามการเปลี่ยนสถานะ / ช่าง และตรงกับการ rebuild ใหม่ทั้งหมด"""
+        from .analytics import rebuild
+
+        shared = self._item("FIXING", technicians=[self.tech_a, self.tech_b])
+        self._item("RECEIVED", technicians=[self.tech_a])
+        shared = RepairItem.objects.get(pk=shared.pk)
+        shared.status = "COMPLETED"
+        shared.final_cost = Decimal("1500.00")
+        shared.save()
+
+        totals = RepairDailyStat.objects.filter(technician_id=0)
+        self.assertEqual(sum(totals.values_list("received", flat=True)), 2)
+        self.assertEqual(totals.get(status="COMPLETED").income, Decimal("1500.00"))
+        self.assertEqual(RepairDailyStat.objects.get(technician_id=self.tech_b.pk, status="COMPLETED").items, 1)
+
+        shared.technicians.remove(self.tech_b)
+        self.assertFalse(RepairDailyStat.objects.filter(technician_id=self.tech_b.pk).exists())
+
+        incremental = set(RepairDailyStat.objects.values_list(
+            "day", "technician_id", "repair_type_id", "status", "received", "items", "income"))
+        rebuild()
+        rebuilt = set(RepairDailyStat.objects.values_list(
+            "day", "technician_id", "repair_type_id", "status", "received", "items", "income"))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_dashboard_reads_rollup(self):
+        self._item("COMPLETED", final_cost=Decimal("800.00"), technicians=[self.tech_a, self.tech_b])
+        self._item("WAITING_APPROVAL", technicians=[self.tech_a])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("repairs:dashboard"))
+        self.assertEqual(response.status_code, 200)
+        # มีแค่ Top Customers ที่ยัง join RepairItem — ตัวเลขที่เหลือมาจาก RepairDailyStat
+        item_queries = [q for q in queries.captured_queries if 'FROM "repairs_repairitem"' in q["sql"]]
+        self.assertEqual(item_queries, [])
+        ctx = response.context
+        self.assertEqual(ctx["period_income"], Decimal("800.00"))
+        self.assertEqual(ctx["active_repairs"], 1)
+        self.assertEqual(ctx["awaiting_approval"], 1)
+        self.assertEqual(ctx["total_jobs_in_period"], 2)
+        tech_a = next(t for t in ctx["tech_stats"] if t["name"] == "Tech A")
+        self.assertEqual((tech_a["active"], tech_a["completed"], tech_a["income"]), (1, 1, Decimal("800.00")))
+        self.assertEqual(ctx["type_stats"][0]["income"], Decimal("800.00"))
@@ -54,12 +54,51 @@ def dashboard(request):
     ]
 
     # --- Data Queries ---
-    
-    # Base filter for items created/received in period
-    period_items = RepairItem.objects.filter(created_at__range=range_filter)
+    # ตัวเลขทั้งหมดมาจากตารางสรุป RepairDailyStat (repairs/analytics.py) — query แถวสรุปของช่วงที่เลือก 1 ครั้ง
+    # + แถวสรุปของงานค้าง/รายได้สะสมทั้งหมดแบบ grouped อีก 1 ครั้ง แทนการวน count() ทีละช่าง × ประเภทงาน × วัน
+    from .analytics import ALL_TECHNICIANS, CLOSED_STATUSES
+    from .models import RepairDailyStat
+
+    # แถวสรุปในช่วงที่เลือก: received = รับเข้าในวันนั้น (created_at), items/income = แก้ไขล่าสุดในวันนั้น (updated_at)
+    period_rows = list(RepairDailyStat.objects.filter(day__range=[start_date, end_date]).values_list(
+        'day', 'technician_id', 'repair_type_id', 'status', 'received', 'items', 'income'
+    ))
+    # งานค้างปัจจุบัน + รายได้สะสมตลอดกาล (รวมทุกวัน)
+    lifetime_rows = list(
+        RepairDailyStat.objects.filter(Q(status='COMPLETED') | ~Q(status__in=CLOSED_STATUSES))
+        .values('technician_id', 'repair_type_id', 'status')
+        .annotate(item_count=Sum('items'), income_total=Sum('income'))
+        .values_list('technician_id', 'repair_type_id', 'status', 'item_count', 'income_total')
+    )
+
+    received_by_status = defaultdict(int)
+    received_by_day = defaultdict(int)
+    done_count = defaultdict(int)          # (tech, type) → FINISHED/COMPLETED ในช่วงที่เลือก
+    done_income = defaultdict(Decimal)     # (tech, type) → รายได้ COMPLETED ในช่วงที่เลือก
+    for day, tech_id, type_id, status, received, items, income in period_rows:
+        if tech_id == ALL_TECHNICIANS:
+            received_by_status[status] += received
+            received_by_day[day] += received
+        if status in ('FINISHED', 'COMPLETED'):
+            done_count[(tech_id, type_id)] += items
+        if status == 'COMPLETED':
+            done_income[(tech_id, type_id)] += income
+
+    active_count = defaultdict(int)        # (tech, type) → งานค้างปัจจุบัน
+    lifetime_income = defaultdict(Decimal)  # (tech, type) → รายได้สะสม
+    for tech_id, type_id, status, items, income in lifetime_rows:
+        if status == 'COMPLETED':
+            lifetime_income[(tech_id, type_id)] += income or 0
+        else:
+            active_count[(tech_id, type_id)] += items or 0
+
+    def _total(values, tech_id=None, type_id=None):
+        return sum(
+            v for (t, rt), v in values.items()
+            if (tech_id is None or t == tech_id) and (type_id is None or rt == type_id)
+        )
 
     # 1. Overall Status Statistics (of items created in period)
-    status_summary = period_items.values('status').annotate(count=Count('id'))
     ordered_statuses = [
         ('RECEIVED', '#ef4444'),
         ('FIXING', '#ff9100'),
@@ -72,37 +111,27 @@ def dashboard(request):
         ('COMPLETED', '#1f2937'),
     ]
     
-    counts_map = {item['status']: item['count'] for item in status_summary}
     status_labels = []
     status_values = []
     status_colors = []
     status_display_map = dict(RepairItem.STATUS_CHOICES)
     for code, color in ordered_statuses:
         status_labels.append(status_display_map.get(code, code))
-        status_values.append(counts_map.get(code, 0))
+        status_values.append(received_by_status.get(code, 0))
         status_colors.append(color)
 
     # 2. Technician Performance (Active is current, Completed is within period)
+    repair_types = list(RepairType.objects.all())
     tech_stats = []
     technicians = Technician.objects.all()
     for tech in technicians:
-        active_count = tech.repairitem_set.exclude(status__in=['FINISHED', 'CANCELLED', 'COMPLETED']).count()
-        completed_period_items = tech.repairitem_set.filter(
-            status__in=['FINISHED', 'COMPLETED'],
-            updated_at__range=range_filter
-        )
-        completed_period_count = completed_period_items.count()
-        
-        # Calculate income for items this technician was part of (within period)
-        tech_income_period = completed_period_items.filter(status='COMPLETED').aggregate(total=Sum('final_cost'))['total'] or 0
-        
-        # Calculate lifetime income for this technician
-        tech_income_lifetime = tech.repairitem_set.filter(status='COMPLETED').aggregate(total=Sum('final_cost'))['total'] or 0
+        active = _total(active_count, tech.pk)
+        completed_period_count = _total(done_count, tech.pk)
         
         # Income breakdown by type
         type_incomes = []
-        for rt in RepairType.objects.all():
-            val = completed_period_items.filter(status='COMPLETED', job__repair_type=rt).aggregate(total=Sum('final_cost'))['total'] or 0
+        for rt in repair_types:
+            val = done_income.get((tech.pk, rt.pk), 0)
             if val > 0:
                 type_incomes.append({
                     'name': rt.name, 
@@ -114,23 +143,19 @@ def dashboard(request):
 
         tech_stats.append({
             'name': tech.name,
-            'active': active_count,
+            'active': active,
             'completed': completed_period_count,
-            'income': tech_income_period,
-            'lifetime_income': tech_income_lifetime,
+            'income': _total(done_income, tech.pk),
+            'lifetime_income': _total(lifetime_income, tech.pk),
             'type_incomes': type_incomes,
-            'total': active_count + completed_period_count
+            'total': active + completed_period_count
         })
     # Sort by income in period primarily, then active jobs
     tech_stats.sort(key=lambda x: (x['income'], x['active']), reverse=True)
 
     # 3. Income Summary (within period)
-    income_items = RepairItem.objects.filter(
-        status='COMPLETED', 
-        updated_at__range=range_filter
-    )
-    period_income = income_items.aggregate(total=Sum('final_cost'))['total'] or 0
-    total_lifetime_income = RepairItem.objects.filter(status='COMPLETED').aggregate(total=Sum('final_cost'))['total'] or 0
+    period_income = _total(done_income, ALL_TECHNICIANS)
+    total_lifetime_income = _total(lifetime_income, ALL_TECHNICIANS)
     
     # 4. Top Customers (within period)
     top_customers = Customer.objects.annotate(
@@ -139,55 +164,28 @@ def dashboard(request):
     ).filter(total_spent_period__gt=0).order_by('-total_spent_period')[:5]
 
     # 5. Trend Graph (Last 30 days or based on range)
-    # If range is small (<= 31 days), show daily. If larger, maybe monthly?
+    # If range is small (<= 31 days), show daily. If larger, sample ~15 points across the range.
     days_diff = (end_date - start_date).days
+    step = 1 if days_diff <= 31 else max(1, days_diff // 15)
     daily_labels = []
     daily_values = []
-    
-    if days_diff <= 31:
-        # Show daily for the range
-        current = start_date
-        while current <= end_date:
-            count = RepairItem.objects.filter(created_at__date=current).count()
-            daily_labels.append(current.strftime('%d/%m'))
-            daily_values.append(count)
-            current += datetime.timedelta(days=1)
-    else:
-        # Show monthly summary if range is large
-        # For simplicity, if > 31 days, just show last 7 days trend or some fixed sample
-        # Let's just do last 10 points or something.
-        # Better: just stick to daily for the selected range if it's reasonable.
-        # Let's limit to 30 points.
-        step = max(1, days_diff // 15)
-        current = start_date
-        while current <= end_date:
-            count = RepairItem.objects.filter(created_at__date=current).count()
-            daily_labels.append(current.strftime('%d/%m'))
-            daily_values.append(count)
-            current += datetime.timedelta(days=step)
+    current = start_date
+    while current <= end_date:
+        daily_labels.append(current.strftime('%d/%m'))
+        daily_values.append(received_by_day.get(current, 0))
+        current += datetime.timedelta(days=step)
 
     # 6. Repair Type Stats (within period)
-    repair_types = RepairType.objects.all()
     type_stats = []
     for rt in repair_types:
-        active = RepairItem.objects.filter(
-            job__repair_type=rt
-        ).exclude(status__in=['FINISHED', 'CANCELLED', 'COMPLETED']).count()
-        
-        completed_period = RepairItem.objects.filter(
-            job__repair_type=rt,
-            status__in=['FINISHED', 'COMPLETED'],
-            updated_at__range=range_filter
-        )
-        
-        income = completed_period.filter(status='COMPLETED').aggregate(total=Sum('final_cost'))['total'] or 0
-        
-        if active > 0 or completed_period.count() > 0:
+        active = _total(active_count, ALL_TECHNICIANS, rt.pk)
+        completed = _total(done_count, ALL_TECHNICIANS, rt.pk)
+        if active > 0 or completed > 0:
             type_stats.append({
                 'type': rt,
                 'active': active,
-                'completed': completed_period.count(),
-                'income': income,
+                'completed': completed,
+                'income': _total(done_income, ALL_TECHNICIANS, rt.pk),
             })
     type_stats.sort(key=lambda x: x['income'], reverse=True)
 
@@ -202,9 +200,9 @@ def dashboard(request):
         'top_customers': top_customers,
         'daily_labels': json.dumps(daily_labels),
         'daily_values': json.dumps(daily_values),
-        'active_repairs': RepairItem.objects.exclude(status__in=['FINISHED', 'CANCELLED', 'COMPLETED']).count(),
-        'awaiting_approval': RepairItem.objects.filter(status='WAITING_APPROVAL', created_at__range=range_filter).count(),
-        'total_jobs_in_period': period_items.count(),
+        'active_repairs': _total(active_count, ALL_TECHNICIANS),
+        'awaiting_approval': received_by_status.get('WAITING_APPROVAL', 0),
+        'total_jobs_in_period': sum(received_by_status.values()),
         # For Form persistence
         'start_date': start_date,
         'end_date': end_date,
@@ -948,17 +946,37 @@ def repair_income_report(request):
         'users': users,
         'filter_user_id': filter_user_id,
         'user_income_list': user_income_list,
-        'daily_income_json': _build_daily_income_json(items_list, start_date, end_date),
+        'daily_income_json': _build_daily_income_json(
+            None if filter_user_id else _daily_income_from_stats(start_date, end_date),
+            items_list, start_date, end_date,
+        ),
     })
 
 
-def _build_daily_income_json(items_list, start_date, end_date):
-    """Build JSON data for daily income chart."""
-    daily = defaultdict(lambda: {'income': Decimal('0'), 'count': 0})
-    for item in items_list:
-        day_key = item.updated_at.strftime('%Y-%m-%d')
-        daily[day_key]['income'] += (item.final_cost or Decimal('0'))
-        daily[day_key]['count'] += 1
+def _daily_income_from_stats(start_date, end_date):
+    """รายได้/จำนวนงานที่ส่งคืนรายวันจาก RepairDailyStat (grouped query เดียว)"""
+    from .analytics import ALL_TECHNICIANS
+    from .models import RepairDailyStat
+
+    rows = RepairDailyStat.objects.filter(
+        day__range=[start_date, end_date], status='COMPLETED', technician_id=ALL_TECHNICIANS,
+    ).values('day').annotate(income=Sum('income'), count=Sum('items'))
+    return {
+        row['day'].strftime('%Y-%m-%d'): {'income': row['income'] or Decimal('0'), 'count': row['count'] or 0}
+        for row in rows
+    }
+
+
+def _build_daily_income_json(daily, items_list, start_date, end_date):
+    """Build JSON data for daily income chart (daily=None → รวมจาก items_list เช่นตอนกรองตามผู้ใช้)"""
+    if daily is None:
+        daily = defaultdict(lambda: {'income': Decimal('0'), 'count': 0})
+        for item in items_list:
+            day_key = timezone.localtime(item.updated_at).strftime('%Y-%m-%d')
+            daily[day_key]['income'] += (item.final_cost or Decimal('0'))
+            daily[day_key]['count'] += 1
+    else:
+        daily = defaultdict(lambda: {'income': Decimal('0'), 'count': 0}, daily)
 
     # Fill in all days in the range
     labels = []
@@ -0,0 +1,82 @@
+/**
+ * sse_stream.js — อ่านผลวิเคราะห์ AI แบบ Server-Sent Events (utils/llm_stream.py)
+ * ใช้ fetch + ReadableStream แทน EventSource เพราะบาง endpoint เป็น POST (ส่งข้อมูล indicator / สรุปงาน)
+ *
+ * streamSSE(url, fetchOptions, handlers) → Promise
+ *   handlers.status({message, ...})   — ขั้นตอนเตรียมข้อมูล
+ *   handlers.chunk(textSoFar, {text}) — ข้อความที่สะสมถึงตอนนี้
+ *   handlers.done({text, ...})        — ข้อความสุดท้าย (แทนที่ข้อความที่สะสมมา)
+ *   handlers.error(message)           — HTTP error / event error / network error
+ */
+(function () {
+    'use strict';
+
+    function parseEvent(block) {
+        var event = 'message', data = [];
+        block.split('\n').forEach(function (line) {
+            if (line.indexOf('event:') === 0) event = line.slice(6).trim();
+            else if (line.indexOf('data:') === 0) data.push(line.slice(5).replace(/^ /, ''));
+        });
+        if (!data.length) return null;   // comment / keep-alive
+        try {
+            return { event: event, data: JSON.parse(data.join('\n')) };
+        } catch (e) {
+            return null;
+        }
+    }
+
+    window.streamSSE = function (url, fetchOptions, handlers) {
+        handlers = handlers || {};
+        var text = '';
+        var finished = false;
+
+        function dispatch(msg) {
+            if (msg.event === 'chunk') {
+                text += msg.data.text;
+                if (handlers.chunk) handlers.chunk(text, msg.data);
+            } else if (msg.event === 'done') {
+                finished = true;
+                if (handlers.done) handlers.done(msg.data);
+            } else if (msg.event === 'error') {
+                finished = true;
+                if (handlers.error) handlers.error(msg.data.error);
+            } else if (msg.event === 'status' && handlers.status) {
+                handlers.status(msg.data);
+            }
+        }
+
+        return fetch(url, fetchOptions || {}).then(function (response) {
+            var type = response.headers.get('Content-Type') || '';
+            if (type.indexOf('text/event-stream') !== 0) {
+                // ตรวจสอบไม่ผ่านก่อนเริ่ม stream — endpoint ตอบ JSON {error}
+                return response.json().then(function (body) {
+                    finished = true;
+                    if (handlers.error) handlers.error(body.error || ('HTTP ' + response.status));
+                });
+            }
+            var reader = response.body.getReader();
+            var decoder = new TextDecoder();
+            var buffer = '';
+
+            function pump() {
+                return reader.read().then(function (result) {
+                    if (result.done) {
+                        if (!finished && handlers.error) handlers.error('การเชื่อมต่อถูกตัดก่อนได้คำตอบครบ');
+                        return;
+                    }
+                    buffer += decoder.decode(result.value, { stream: true });
+                    var parts = buffer.split('\n\n');
+                    buffer = parts.pop();
+                    parts.forEach(function (block) {
+                        var msg = parseEvent(block);
+                        if (msg) dispatch(msg);
+                    });
+                    return pump();
+                });
+            }
+            return pump();
+        }).catch(function (err) {
+            if (!finished && handlers.error) handlers.error(String(err));
+        });
+    };
+})();
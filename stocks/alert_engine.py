@@ -6,11 +6,13 @@ from datetime import time as dtime
 from datetime import timedelta
 
 import pytz
-import yfinance as yf
 from django.core.cache import cache
 from django.utils import timezone as dj_timezone
 
-from .models import AssetCategory, MarketType, Portfolio, Watchlist, PrecisionScanCandidate, StockAlertEvent
+from .models import (
+    AssetCategory, MarketType, Portfolio, Watchlist, PrecisionScanCandidate, StockAlertConfig, StockAlertEvent,
+)
+from .quote_service import get_live_prices
 from .utils import simple_trailing_stop
 
 # ตลาดที่ไม่ควรเติม .BK (หุ้น US, Crypto, Forex ฯลฯ ใช้ symbol ตามที่กรอกตรงๆ)
@@ -72,7 +74,7 @@ def _to_yf_symbol(symbol, market=None):
 
 def fetch_live_prices(symbol_market_pairs):
     """
-    ดึงราคาปัจจุบันแบบ batch
+    ดึงราคาปัจจุบันแบบ batch ผ่าน quote_service (cache ร่วมกับทุกหน้า/คำสั่ง)
     symbol_market_pairs: iterable ของ (symbol, market) — market ใช้ตัดสินว่าต้องเติม .BK หรือไม่
     คืนค่าเป็น {original_symbol: price}
     """
@@ -81,19 +83,11 @@ def fetch_live_prices(symbol_market_pairs):
         return {}
 
     yf_symbols = [_to_yf_symbol(sym, mkt) for sym, mkt in pairs]
+    prices = get_live_prices(yf_symbols)
     live_prices = {}
-    try:
-        tickers = yf.Tickers(" ".join(yf_symbols))
-        for (original_sym, _mkt), yf_sym in zip(pairs, yf_symbols):
-            try:
-                t = tickers.tickers[yf_sym]
-                price = t.info.get('currentPrice') or t.fast_info.last_price
-                if price:
-                    live_prices[original_sym] = float(price)
-            except Exception:
-                continue
-    except Exception:
-        pass
+    for (original_sym, _mkt), yf_sym in zip(pairs, yf_symbols):
+        if yf_sym in prices:
+            live_prices[original_sym] = prices[yf_sym]
     return live_prices
 
 
@@ -471,5 +465,49 @@ def evaluate_user_alerts(user, config):
 
     if new_events:
         StockAlertEvent.objects.bulk_create(new_events)
+        refresh_unread_alert_state(user)
 
     return sorted(new_events, key=lambda e: e.symbol)
+
+
+# ====== สรุปแจ้งเตือนที่ยังไม่ได้อ่าน (ต่อ user) เก็บไว้ใน cache ======
+# context processor อ่านค่านี้อย่างเดียวตอน render ทุกหน้า (ไม่มีการดึงราคาจาก Yahoo ใน render path)
+# ส่วนการประเมิน alert จริงทำใน background โดย management command check_web_alerts --loop
+# ค่าจะถูกคำนวณใหม่ทุกครั้งที่มี event ใหม่ / อ่านแล้ว / ลบทิ้ง / เปลี่ยน config
+
+_UNREAD_STATE_CACHE_KEY = 'stockalert_unread_{user_id}'
+_UNREAD_PREVIEW_LIMIT = 3  # จำนวน event ล่าสุดที่ context processor นำไปแสดงเป็น message บนหน้าเว็บ
+
+
+def refresh_unread_alert_state(user):
+    """
+    คำนวณสรุปแจ้งเตือนที่ยังไม่ได้อ่านของ user จากฐานข้อมูลแล้วเก็บลง cache (ไม่หมดอายุเอง)
+    คืนค่า dict: enabled, count, latest (event ล่าสุดไม่เกิน _UNREAD_PREVIEW_LIMIT รายการ)
+    """
+    user_id = getattr(user, 'pk', user)
+    unread = StockAlertEvent.objects.filter(user_id=user_id, is_read=False)
+    state = {
+        'enabled': StockAlertConfig.objects.filter(user_id=user_id, enabled=True).exists(),
+        'count': unread.count(),
+        'latest': [
+            {
+                'id': e.id,
+                'symbol': e.symbol,
+                'message': e.message,
+                'alert_type': e.alert_type,
+                'type_label': e.get_alert_type_display(),
+            }
+            for e in unread.order_by('-created_at')[:_UNREAD_PREVIEW_LIMIT]
+        ],
+    }
+    cache.set(_UNREAD_STATE_CACHE_KEY.format(user_id=user_id), state, timeout=None)
+    return state
+
+
+def get_unread_alert_state(user):
+    """อ่านสรุปแจ้งเตือนที่ยังไม่ได้อ่านจาก cache (ถ้ายังไม่มีค่อยคำนวณจาก DB ครั้งเดียว ไม่มี network I/O)"""
+    user_id = getattr(user, 'pk', user)
+    state = cache.get(_UNREAD_STATE_CACHE_KEY.format(user_id=user_id))
+    if state is None:
+        state = refresh_unread_alert_state(user_id)
+    return state
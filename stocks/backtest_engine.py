@@ -0,0 +1,173 @@
+# ====== backtest_engine.py — backtest preset แบบ vectorized ทั้ง universe + parameter sweep ======
+# เดิม run_all_presets_backtest_universe เรียก _generate_preset_trades ทีละ preset ต่อหุ้นแต่ละตัว:
+#   - _build_preset_indicators (rolling/EMA/RSI ทั้งก้อน) ถูกคำนวณซ้ำ 5 รอบต่อหุ้นหนึ่งตัว
+#   - หา SL/TP ด้วย while ทีละแท่ง + for j ซ้อนอีกชั้นต่อสัญญาณ (Python loop ล้วน)
+#
+# โมดูลนี้:
+#   - คำนวณ indicator ครั้งเดียวต่อหุ้น แล้วได้สัญญาณของทุก preset จากเฟรมเดียวกัน
+#   - หาจุดออก (SL / TP / หมดเวลาถือ) ของ "ทุกวันที่มีสัญญาณ" พร้อมกันด้วยหน้าต่าง NumPy (n × max_hold)
+#     จากนั้นค่อยเดินเฉพาะจุดเข้าจริง (ข้ามสัญญาณที่ยังถือไม่หมด) — วนตามจำนวนเทรด ไม่ใช่จำนวนแท่ง
+#   - SL% / RR / วันถือ หลายค่า (grid) ใช้หน้าต่างเดียวกัน ไม่ต้องคำนวณ indicator ใหม่
+#   - หุ้นหลายตัวกระจายไป process pool ถาวรของ scan_executor (forkserver, CPU-bound ล้วน ไม่ติด GIL เหมือน ThreadPool)
+#     ใช้ pool เดียวกับ scanner — ไม่ fork process ใหม่จาก web process ที่มีหลาย thread ทุกครั้งที่มีคำขอ
+#
+# ผลลัพธ์ตรงกับ _generate_preset_trades เดิมทุกเทรด (ลำดับการเช็ค SL ก่อน TP ในวันเดียวกันเหมือนเดิม)
+
+import logging
+import os
+from itertools import product
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .utils import PRESET_DEFINITIONS, _build_preset_indicators, _preset_signal, _summarize_trades
+
+logger = logging.getLogger(__name__)
+
+# เว้นช่วง warm-up ให้ indicator นิ่งก่อน (เท่ากับ _generate_preset_trades)
+_WARMUP_BARS = 200
+# หุ้นน้อยกว่านี้รันใน process เดียว — ค่าส่ง DataFrame ข้าม process ไม่คุ้ม
+_POOL_MIN_SYMBOLS = 8
+_POOL_MAX_WORKERS = 8
+
+
+def _exit_windows(lows, highs, max_hold):
+    """หน้าต่าง low/high ของ max_hold วันถัดจากแต่ละแท่ง (shape n × max_hold, เกินท้ายข้อมูลเป็น NaN)"""
+    pad = np.full(max_hold, np.nan)
+    low_w = sliding_window_view(np.concatenate([lows[1:], pad]), max_hold)[:len(lows)]
+    high_w = sliding_window_view(np.concatenate([highs[1:], pad]), max_hold)[:len(highs)]
+    return low_w, high_w
+
+
+def _simulate(entries, closes, low_w, high_w, sl_pct, rr_target, max_hold_days):
+    """
+    จำลองเทรดจากแท่งที่มีสัญญาณ (entries เรียงจากน้อยไปมาก) คืน (ret_pct, hold_days) เป็น ndarray
+    เทรดใหม่เข้าได้เมื่อแท่งสัญญาณอยู่หลังวันออกของเทรดก่อนหน้าเท่านั้น
+    """
+    if len(entries) == 0:
+        return np.empty(0), np.empty(0, dtype=np.int64)
+
+    n = len(closes)
+    entry = closes[entries]
+    sl = entry * (1 - sl_pct / 100)
+    tp = entry + (entry - sl) * rr_target
+
+    lw = low_w[entries, :max_hold_days]
+    hw = high_w[entries, :max_hold_days]
+    sl_hit = lw <= sl[:, None]
+    hit = sl_hit | (hw >= tp[:, None])
+    has_hit = hit.any(axis=1)
+    first = hit.argmax(axis=1)
+
+    # ไม่โดน SL/TP → ออกที่ราคาปิดวันสุดท้ายของช่วงถือ (หรือแท่งสุดท้ายของข้อมูล)
+    timeout_idx = np.minimum(entries + max_hold_days, n - 1)
+    hold = np.where(has_hit, first + 1, timeout_idx - entries)
+    exit_price = np.where(
+        has_hit,
+        np.where(sl_hit[np.arange(len(entries)), first], sl, tp),
+        closes[timeout_idx],
+    )
+    rets = (exit_price - entry) / entry * 100
+
+    # เดินเฉพาะเทรดที่เข้าจริง: ข้ามไปยังสัญญาณแรกที่อยู่หลังวันออกด้วย searchsorted
+    taken = []
+    k = 0
+    while k < len(entries):
+        taken.append(k)
+        k = int(np.searchsorted(entries, entries[k] + hold[k], side='right'))
+    taken = np.asarray(taken, dtype=np.int64)
+    return rets[taken], hold[taken]
+
+
+def _symbol_trades(df, grid, period_days, presets):
+    """
+    เทรดทุก preset × ทุกชุดพารามิเตอร์ใน grid ของหุ้นหนึ่งตัว
+    คืน {(preset, sl_pct, rr_target, max_hold_days): (rets, holds)} หรือ None ถ้าข้อมูลไม่พอ
+    """
+    if df is None or len(df) < _WARMUP_BARS:
+        return None
+
+    d = _build_preset_indicators(df).tail(period_days + _WARMUP_BARS).reset_index(drop=True)
+    closes = d['Close'].to_numpy(dtype=float)
+    lows = d['Low'].to_numpy(dtype=float)
+    highs = d['High'].to_numpy(dtype=float)
+    n = len(d)
+    if n <= _WARMUP_BARS + 1:
+        return {}
+
+    low_w, high_w = _exit_windows(lows, highs, max(h for _, _, h in grid))
+    out = {}
+    for preset in presets:
+        signal = _preset_signal(d, preset).fillna(False).to_numpy(dtype=bool)
+        entries = np.flatnonzero(signal[_WARMUP_BARS:n - 1]) + _WARMUP_BARS
+        for sl_pct, rr_target, max_hold_days in grid:
+            out[(preset, sl_pct, rr_target, max_hold_days)] = _simulate(
+                entries, closes, low_w, high_w, sl_pct, rr_target, max_hold_days)
+    return out
+
+
+def _symbol_trades_job(args):
+    # entry point ของ worker ใน process pool (ต้องเป็นฟังก์ชันระดับโมดูลให้ pickle ได้)
+    symbol, df, grid, period_days, presets = args
+    try:
+        return symbol, _symbol_trades(df, grid, period_days, presets)
+    except Exception as e:
+        logger.warning("backtest_engine %s failed: %s", symbol, e)
+        return symbol, None
+
+
+def _run_symbols(symbol_dfs, grid, period_days, presets, workers):
+    from django.conf import settings
+
+    from .scan_executor import get_pool, reset_pool
+
+    jobs = [(sym, df, grid, period_days, presets) for sym, df in symbol_dfs.items()]
+    if workers is None:
+        workers = min(_POOL_MAX_WORKERS, os.cpu_count() or 1)
+    use_pool = getattr(settings, 'SCAN_EXECUTOR', 'process') == 'process'
+    if use_pool and workers > 1 and len(jobs) >= _POOL_MIN_SYMBOLS:
+        try:
+            # map คืนผลตามลำดับ symbol เดิม → ลำดับเทรดใน pool (และ drawdown) เหมือนรันทีละตัว
+            return list(get_pool().map(_symbol_trades_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+        except Exception as e:
+            logger.warning("backtest_engine process pool failed, running in-process: %s", e)
+            reset_pool()
+    return [_symbol_trades_job(job) for job in jobs]
+
+
+def run_presets_sweep_universe(symbol_dfs, sl_pcts=(3.0,), rr_targets=(1.5,), max_hold_days=(20,),
+                               period_days=750, presets=None, workers=None):
+    """
+    Backtest ทุก preset × ทุกชุด (sl_pct, rr_target, max_hold_days) รวมสัญญาณทั้ง universe เป็น trade pool
+    symbol_dfs: dict {symbol: dataframe ราคาย้อนหลัง}
+    workers: 1 = รันใน process เดียว / อื่นๆ = ใช้ process pool ถาวรของ scan_executor
+             (จำนวน process ตาม SCAN_PROCESS_WORKERS — ค่านี้ใช้แค่กำหนดขนาด chunk)
+    Returns: list ของสรุปผลหน้าตาเดียวกับ run_preset_backtest_universe + sl_pct / rr_target / max_hold_days
+    """
+    presets = list(presets or PRESET_DEFINITIONS)
+    grid = list(product(sl_pcts, rr_targets, max_hold_days))
+    results = _run_symbols(symbol_dfs, grid, period_days, presets, workers)
+
+    rows = []
+    for preset, (sl_pct, rr_target, hold_days) in product(presets, grid):
+        key = (preset, sl_pct, rr_target, hold_days)
+        trades = []
+        symbols_tested = symbols_with_signal = 0
+        for _, per_key in results:
+            if per_key is None:
+                continue
+            symbols_tested += 1
+            rets, holds = per_key.get(key, ((), ()))
+            if len(rets):
+                symbols_with_signal += 1
+                trades.extend({'ret_pct': float(r), 'hold_days': int(h)} for r, h in zip(rets, holds))
+        summary = _summarize_trades(preset, trades)
+        summary.update({
+            'symbols_tested': symbols_tested,
+            'symbols_with_signal': symbols_with_signal,
+            'sl_pct': sl_pct,
+            'rr_target': rr_target,
+            'max_hold_days': hold_days,
+        })
+        rows.append(summary)
+    return rows
@@ -0,0 +1,352 @@
+# ====== bar_store.py — คลังแท่งราคา OHLCV กลางที่ทุก scanner/หน้าเว็บอ่านร่วมกัน ======
+# เดิม scanner แต่ละตัว (Precision, Momentum, SEPA, Cup&Handle, Turtle, Mean Reversion ฯลฯ ทั้ง SET/US)
+# ดึงประวัติ 1 ปี–600 วันจาก Yahoo เองทุกครั้งที่กดสแกน หุ้นชุดเดิม ~400 ตัวถูกโหลดซ้ำหลายสิบรอบต่อวัน
+#
+# โมดูลนี้เก็บแท่งราคาไว้ในตาราง PriceBar (symbol, interval, date) แล้วเติมเฉพาะ "หางที่ขาด" ให้:
+#   - หุ้นที่ยังไม่เคยมีในคลัง → โหลดประวัติเต็มครั้งเดียว
+#   - หุ้นที่มีแล้ว → ดึงแค่ไม่กี่วันล่าสุด (ทับแท่งท้ายเดิมเพื่ออัปเดตแท่งวันนี้ที่ยังไม่ปิด)
+#   - ถ้าแท่งที่ทับกันราคาไม่ตรงกับของเดิม (มีปันผล/แตกพาร์ → adjusted price เลื่อนทั้งเส้น) → โหลดใหม่ทั้งเส้น
+# หุ้นที่ต้องเติมจากวันเริ่มเดียวกันถูกรวบเป็น yf.download() ก้อนเดียว (ทีละ _FETCH_CHUNK ตัว)
+# สแกนเต็มตลาดจึงเหลือแค่ delta fetch รอบเดียว แทนการโหลดประวัติเต็มหลายร้อยครั้ง
+#
+# ใช้งาน: get_bars(['PTT.BK', 'AOT.BK'], start, end) → {'PTT.BK': DataFrame(Open/High/Low/Close/Volume), ...}
+# symbol ใช้รูปแบบ Yahoo ตรงๆ (เติม .BK เอง) เหมือนที่ scanner ส่งให้ yfinance อยู่แล้ว
+
+import logging
+from collections import defaultdict
+from datetime import date as ddate
+from datetime import datetime, timedelta
+
+import pandas as pd
+import yfinance as yf
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone as dj_timezone
+
+from .models import MarketType, PriceBar
+
+logger = logging.getLogger(__name__)
+
+_OHLCV = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# โหลดประวัติเต็มย้อนหลังกี่วัน (ปฏิทิน) ตอนเจอหุ้นใหม่ — ครอบคลุม scanner ที่ขอยาวสุด (600 วัน + warm-up)
+_DEFAULT_HISTORY_DAYS = 800
+# ดึงทับย้อนหลังจากแท่งสุดท้ายที่มีกี่วัน (ปฏิทิน) — เผื่อวันหยุดยาว ให้ได้แท่งทับกันอย่างน้อย 2-3 แท่งไว้ตรวจ adjustment
+_OVERLAP_DAYS = 7
+# ราคาปิดของแท่งที่ทับกันต่างจากของเดิมเกินเท่านี้ = มี corporate action → โหลดใหม่ทั้งเส้น
+_ADJ_TOLERANCE = 0.005
+# yf.download ทีละกี่ symbol (เท่ากับ chunk ที่ scanner ใช้อยู่เดิม กันโดน rate limit/ค้าง)
+_FETCH_CHUNK = 80
+_BULK_BATCH = 2000
+
+# เพิ่งเติมหางไปไม่นาน → ข้ามการยิง Yahoo รอบนี้ (ระหว่างตลาดเปิดแท่งวันนี้ยังขยับ จึงใช้ TTL สั้นกว่า)
+_FRESH_CACHE_KEY = 'barstore_fresh_{interval}_{symbol}'
+_FRESH_TTL_MARKET_OPEN = 5 * 60
+_FRESH_TTL_MARKET_CLOSED = 60 * 60
+
+# วันเริ่มของการโหลดเต็มครั้งล่าสุดต่อ symbol — จำไว้นานๆ กันหุ้น IPO (แท่งแรกใหม่กว่าช่วงที่ขอ) ถูกโหลดเต็มซ้ำทุกรอบ
+_LOADED_FROM_CACHE_KEY = 'barstore_loaded_from_{interval}_{symbol}'
+_LOADED_FROM_TTL = 30 * 24 * 60 * 60
+
+
+def _market_of(symbol):
+    """เดาตลาดจาก symbol รูปแบบ Yahoo — ใช้แค่เลือก TTL ของ freshness cache เท่านั้น"""
+    if symbol.endswith('.BK'):
+        return MarketType.SET
+    if '-' in symbol or symbol.endswith('=F') or symbol.endswith('=X'):
+        return MarketType.CRYPTO
+    return MarketType.US
+
+
+def _mark_fresh(symbols, interval):
+    from .alert_engine import is_market_open
+
+    by_ttl = defaultdict(dict)
+    ttl_of_market = {}
+    for s in symbols:
+        market = _market_of(s)
+        if market not in ttl_of_market:
+            ttl_of_market[market] = _FRESH_TTL_MARKET_OPEN if is_market_open(market) else _FRESH_TTL_MARKET_CLOSED
+        by_ttl[ttl_of_market[market]][_FRESH_CACHE_KEY.format(interval=interval, symbol=s)] = True
+    for ttl, keys in by_ttl.items():
+        cache.set_many(keys, timeout=ttl)
+
+
+def _to_date_index(index):
+    """แปลง index ของ yfinance/yahooquery (อาจเป็น tz-aware, date ปนกับ datetime) ให้เป็น datetime.date ล้วน"""
+    out = []
+    for d in index:
+        ts = pd.Timestamp(d)
+        if ts.tzinfo is not None:
+            ts = ts.tz_localize(None)
+        out.append(ts.date())
+    return out
+
+
+def _normalize_frame(df):
+    """ตัดให้เหลือ Open/High/Low/Close/Volume, index เป็นวันที่ (date) เรียงจากเก่าไปใหม่ ไม่มีแถว Close ว่าง"""
+    if df is None or df.empty:
+        return None
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(-1) if 'Close' in df.columns.get_level_values(-1) else df.columns.get_level_values(0)
+    df = df.loc[:, ~df.columns.duplicated()]
+    if any(c not in df.columns for c in _OHLCV):
+        return None
+    df = df[_OHLCV].dropna(subset=['Close', 'High', 'Low'])
+    if df.empty:
+        return None
+    df = df.copy()
+    df.index = _to_date_index(df.index)
+    df['Volume'] = df['Volume'].fillna(0)
+    df['Open'] = df['Open'].fillna(df['Close'])
+    df = df[~pd.Index(df.index).duplicated(keep='last')]
+    return df.sort_index()
+
+
+def _download_yf(symbols, start, interval):
+    """yf.download แบบหลาย symbol ในคำขอเดียว คืน {symbol: DataFrame}"""
+    frames = {}
+    try:
+        data = yf.download(
+            symbols, start=start.strftime('%Y-%m-%d'), interval=interval, group_by='ticker',
+            auto_adjust=True, threads=True, progress=False, timeout=30,
+        )
+    except Exception as e:
+        logger.warning("[BarStore] yf.download failed (%d symbols): %s", len(symbols), e)
+        return frames
+    if data is None or data.empty:
+        return frames
+
+    if isinstance(data.columns, pd.MultiIndex):
+        tickers_in = set(data.columns.get_level_values(0))
+        for sym in symbols:
+            if sym in tickers_in:
+                df = _normalize_frame(data[sym].copy())
+                if df is not None:
+                    frames[sym] = df
+    elif len(symbols) == 1:
+        df = _normalize_frame(data.copy())
+        if df is not None:
+            frames[symbols[0]] = df
+    return frames
+
+
+def _download_yq(symbols, start, interval):
+    """สำรองด้วย yahooquery (ตัวที่ yf.download ไม่คืนข้อมูลให้) — ปรับราคาให้เป็น adjusted เหมือน auto_adjust"""
+    from yahooquery import Ticker as YQTicker
+
+    frames = {}
+    try:
+        hist = YQTicker(symbols).history(start=start.strftime('%Y-%m-%d'), interval=interval)
+    except Exception as e:
+        logger.warning("[BarStore] yahooquery fallback failed (%d symbols): %s", len(symbols), e)
+        return frames
+    if not isinstance(hist, pd.DataFrame) or hist.empty or not isinstance(hist.index, pd.MultiIndex):
+        return frames
+
+    for sym in symbols:
+        if sym not in hist.index.get_level_values(0):
+            continue
+        df = hist.loc[sym].copy()
+        if 'adjclose' in df.columns and 'close' in df.columns:
+            factor = (df['adjclose'] / df['close']).fillna(1.0)
+            for col in ('open', 'high', 'low', 'close'):
+                df[col] = df[col] * factor
+        df = df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'})
+        df = _normalize_frame(df)
+        if df is not None:
+            frames[sym] = df
+    return frames
+
+
+def _fetch(symbols, start, interval):
+    frames = {}
+    for i in range(0, len(symbols), _FETCH_CHUNK):
+        chunk = symbols[i:i + _FETCH_CHUNK]
+        got = _download_yf(chunk, start, interval)
+        missing = [s for s in chunk if s not in got]
+        if missing:
+            got.update(_download_yq(missing, start, interval))
+        frames.update(got)
+    return frames
+
+
+def _store(symbol, interval, df):
+    rows = [
+        PriceBar(
+            symbol=symbol, interval=interval, date=d,
+            open=float(r.Open), high=float(r.High), low=float(r.Low), close=float(r.Close), volume=float(r.Volume),
+        )
+        for d, r in zip(df.index, df.itertuples(index=False))
+    ]
+    PriceBar.objects.bulk_create(
+        rows, batch_size=_BULK_BATCH, update_conflicts=True,
+        unique_fields=['symbol', 'interval', 'date'],
+        update_fields=['open', 'high', 'low', 'close', 'volume'],
+    )
+    return len(rows)
+
+
+def _shifted_symbols(frames, interval, since, last_dates):
+    """
+    เทียบราคาปิดของแท่งที่ทับกันกับของเดิมในคลัง (query เดียวทุก symbol) — ต่างเกิน _ADJ_TOLERANCE
+    แปลว่า adjusted price ทั้งเส้นเลื่อนแล้ว (ปันผล/แตกพาร์) ต้องโหลดใหม่ทั้งเส้น
+    ไม่เทียบแท่งสุดท้ายที่มีในคลัง เพราะอาจถูกเก็บไว้ตอนตลาดยังเปิด (ราคายังไม่ปิดจริง)
+    """
+    stored = defaultdict(dict)
+    for sym, d, close in (
+        PriceBar.objects.filter(symbol__in=list(frames), interval=interval, date__gte=since)
+        .values_list('symbol', 'date', 'close')
+    ):
+        stored[sym][d] = close
+
+    shifted = set()
+    for sym, df in frames.items():
+        last = last_dates.get(sym)
+        for d, close in df['Close'].items():
+            old = stored[sym].get(d)
+            if not old or d >= last:
+                continue
+            if abs(float(close) - old) / abs(old) > _ADJ_TOLERANCE:
+                shifted.add(sym)
+                break
+    return shifted
+
+
+def _mark_loaded(frames, interval, full_start):
+    cache.set_many(
+        {_LOADED_FROM_CACHE_KEY.format(interval=interval, symbol=s): full_start for s in frames},
+        timeout=_LOADED_FROM_TTL,
+    )
+
+
+def refresh_bars(symbols, interval='1d', history_days=_DEFAULT_HISTORY_DAYS, force=False):
+    """
+    เติมแท่งราคาที่ขาดของ symbols ลงคลัง (PriceBar) — เรียกซ้ำได้บ่อยโดยไม่เปลืองเพราะมี freshness cache
+    force=True ข้าม freshness cache (ยังเติมแค่หางเหมือนเดิม)
+    คืนค่าจำนวนแท่งที่เขียนลงคลัง
+    """
+    symbols = list(dict.fromkeys(s for s in symbols if s))
+    if not symbols:
+        return 0
+
+    if not force:
+        fresh = cache.get_many([_FRESH_CACHE_KEY.format(interval=interval, symbol=s) for s in symbols])
+        symbols = [s for s in symbols if _FRESH_CACHE_KEY.format(interval=interval, symbol=s) not in fresh]
+        if not symbols:
+            return 0
+
+    today = dj_timezone.localdate()
+    full_start = today - timedelta(days=history_days)
+    spans = {
+        row['symbol']: (row['first'], row['last'])
+        for row in PriceBar.objects.filter(symbol__in=symbols, interval=interval)
+        .values('symbol').annotate(first=Min('date'), last=Max('date'))
+    }
+    loaded_from = cache.get_many([_LOADED_FROM_CACHE_KEY.format(interval=interval, symbol=s) for s in spans])
+
+    # จัดกลุ่มตาม "วันที่เริ่มดึง" — หุ้นส่วนใหญ่มีแท่งสุดท้ายวันเดียวกัน จึงรวมเป็น yf.download ก้อนเดียวได้
+    by_start = defaultdict(list)
+    for s in symbols:
+        first, last = spans.get(s, (None, None))
+        # คลังมีแท่งย้อนไปไม่ถึงช่วงที่ขอ (เช่นเคยโหลดไว้แค่ 1 ปี แต่รอบนี้ขอ 600 วัน) → โหลดเต็มใหม่ทั้งเส้น
+        # ยกเว้นหุ้นเข้าตลาดใหม่ที่เคยโหลดเต็มไปแล้ว (Yahoo ไม่มีแท่งเก่ากว่านั้นให้อยู่ดี)
+        marker = loaded_from.get(_LOADED_FROM_CACHE_KEY.format(interval=interval, symbol=s))
+        covered = last and (first <= full_start + timedelta(days=_OVERLAP_DAYS) or (marker and marker <= full_start))
+        if covered:
+            by_start[last - timedelta(days=_OVERLAP_DAYS)].append(s)
+        else:
+            by_start[full_start].append(s)
+
+    written = 0
+    reload = []
+    # symbol ที่ได้ข้อมูลกลับมาและเขียนลงคลังแล้วเท่านั้นที่ถือว่า fresh — ตัวที่ Yahoo ไม่ตอบต้องลองใหม่รอบหน้า
+    stored = []
+    for start, group in by_start.items():
+        frames = _fetch(group, start, interval)
+        shifted = set()
+        if start != full_start:
+            shifted = _shifted_symbols(frames, interval, start, {s: spans[s][1] for s in group})
+            reload.extend(shifted)
+        for sym, df in frames.items():
+            if sym not in shifted:
+                written += _store(sym, interval, df)
+                stored.append(sym)
+        if start == full_start:
+            _mark_loaded(frames, interval, full_start)
+
+    if reload:
+        logger.info("[BarStore] adjusted history shifted, reloading %d symbol(s): %s", len(reload), ', '.join(reload[:10]))
+        # ดึงประวัติเต็มก่อน แล้วค่อยแทนที่แท่งเดิมใน transaction เดียว เฉพาะตัวที่ได้ข้อมูลกลับมา
+        # (Yahoo ล่มกลางทาง → แท่งเดิมยังอยู่ครบ ไม่มีใครอ่านเจอเส้นว่าง/ครึ่งเส้น)
+        frames = _fetch(reload, full_start, interval)
+        if frames:
+            with transaction.atomic():
+                PriceBar.objects.filter(symbol__in=list(frames), interval=interval).delete()
+                for sym, df in frames.items():
+                    written += _store(sym, interval, df)
+            stored.extend(frames)
+            _mark_loaded(frames, interval, full_start)
+        failed = [s for s in reload if s not in frames]
+        if failed:
+            logger.warning("[BarStore] reload failed, keeping stored bars of %d symbol(s): %s", len(failed), ', '.join(failed[:10]))
+
+    if stored:
+        _mark_fresh(stored, interval)
+    return written
+
+
+def _as_date(value, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, ddate):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def get_bars(symbols, start=None, end=None, interval='1d', refresh=True):
+    """
+    อ่านแท่งราคาของหลาย symbol จากคลังในคำขอเดียว (เติมหางที่ขาดก่อนถ้า refresh=True)
+    start/end รับได้ทั้ง 'YYYY-MM-DD', date, datetime — end เป็นแบบ exclusive เหมือน yfinance
+    คืนค่า {symbol: DataFrame(Open/High/Low/Close/Volume, DatetimeIndex)} เฉพาะ symbol ที่มีข้อมูล
+    """
+    symbols = list(dict.fromkeys(s for s in symbols if s))
+    if not symbols:
+        return {}
+
+    today = dj_timezone.localdate()
+    start_d = _as_date(start, today - timedelta(days=365))
+    end_d = _as_date(end, today + timedelta(days=1))
+
+    if refresh:
+        history_days = max(_DEFAULT_HISTORY_DAYS, (today - start_d).days + 30)
+        try:
+            refresh_bars(symbols, interval=interval, history_days=history_days)
+        except Exception as e:
+            # Yahoo ล่ม/โดน rate limit — ใช้ข้อมูลที่มีในคลังไปก่อน ดีกว่าสแกนไม่ได้เลย
+            logger.warning("[BarStore] refresh failed, serving stored bars only: %s", e)
+
+    rows = list(
+        PriceBar.objects.filter(symbol__in=symbols, interval=interval, date__gte=start_d, date__lt=end_d)
+        .order_by('symbol', 'date')
+        .values_list('symbol', 'date', 'open', 'high', 'low', 'close', 'volume')
+    )
+    if not rows:
+        return {}
+
+    frame = pd.DataFrame(rows, columns=['symbol', 'Date'] + _OHLCV)
+    frame['Date'] = pd.to_datetime(frame['Date'])
+    return {
+        sym: grp.drop(columns='symbol').set_index('Date')
+        for sym, grp in frame.groupby('symbol', sort=False)
+    }
+
+
+def get_symbol_bars(symbol, start=None, end=None, interval='1d', refresh=True):
+    """ทางลัดของ get_bars() สำหรับ symbol เดียว — ไม่มีข้อมูลคืน DataFrame ว่าง (ใช้ .empty เช็คได้เหมือน yfinance)"""
+    return get_bars([symbol], start=start, end=end, interval=interval, refresh=refresh).get(symbol, pd.DataFrame(columns=_OHLCV))
@@ -0,0 +1,39 @@
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+
+from stocks.scan_jobs import GROUP_NAME, snapshot
+
+
+class ScanStatusConsumer(AsyncWebsocketConsumer):
+    """
+    WebSocket Consumer สำหรับรับสถานะงานสแกนเบื้องหลังของผู้ใช้แต่ละคน (progress / done)
+    stocks.scan_jobs push เข้ามาที่ group ของ user — หน้า scanner ไม่ต้อง poll ?scan_status=1 ถี่ๆ อีก
+    """
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.close()
+            return
+        self.group_name = GROUP_NAME.format(user_id=self.scope["user"].id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        # ต่อใหม่หลังหลุด: ส่งสถานะปัจจุบันของทุกงานให้ก่อน (ข้อความที่ push ไปตอนหลุดอยู่ไม่ถูกเก็บไว้ให้)
+        for status in await database_sync_to_async(snapshot)(self.scope["user"].id):
+            await self.send(text_data=json.dumps({'type': 'scan_status', 'job': status['job'], 'status': status}))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        pass  # Client ไม่ส่งข้อมูลมา
+
+    async def scan_status(self, event):
+        """ส่งสถานะงานสแกนไปยัง WebSocket ของ Client"""
+        await self.send(text_data=json.dumps({
+            'type': 'scan_status',
+            'job': event['job'],
+            'status': event['status'],
+        }))
@@ -1221,26 +1221,26 @@ Write a complete report in Thai with these sections (use markdown headers ##):
 Swing (2-8 สัปดาห์) หรือ Position (3-6 เดือน) — อ้างอิง Volatility และ ATR%"""
         prompt += "\n\nBe specific with numbers. Use actual prices from the data provided."
 
-        # ── Call Gemini directly via new google-genai SDK ───────────
+        # ── Call Gemini via LLM gateway (shared google-genai client) ───────────
         try:
             import os as _os
 
-            import google.genai as _genai
             from google.genai import types as _gtypes
 
+            from utils.llm_gateway import generate as llm_generate
+
             # Ensure only GEMINI_API_KEY is used (suppress GOOGLE_API_KEY conflict)
             _os.environ.pop('GOOGLE_API_KEY', None)
 
-            client = _genai.Client(api_key=settings.GEMINI_API_KEY)
-            response = client.models.generate_content(
+            return llm_generate(
+                prompt,
+                use_case='crew_analysis',
                 model='gemini-2.5-flash',
-                contents=prompt,
                 config=_gtypes.GenerateContentConfig(
                     temperature=0.4,
                     max_output_tokens=8192,
                 ),
             )
-            return response.text
         except Exception as e:
             return f"Analysis failed: {str(e)}"
 
@@ -1414,9 +1414,10 @@ def run_single_call_analysis(symbol: str, scan_data: dict, market: str = 'SET')
     Single Gemini call that emulates 3-agent sequential output.
     Returns markdown string matching the MomentumShortTermCrew format.
     """
-    from google import genai
     from google.genai import types
 
+    from utils.llm_gateway import generate as llm_generate
+
     sd       = scan_data or {}
     currency = 'บาท' if market == 'SET' else 'USD'
     curr_sym = '฿' if market == 'SET' else '$'
@@ -1507,14 +1508,13 @@ def run_single_call_analysis(symbol: str, scan_data: dict, market: str = 'SET')
 วิเคราะห์: Smart Money signal (พิจารณา CMF/RVOL/Volume Surge และสัญญาณการเกิด Pocket Pivot (PP) ในฐานราคา), Sector Momentum, Catalyst, Key Risks (3 ข้อ)
 สรุปสุดท้าย: **BUY NOW** / **WAIT FOR PULLBACK** / **AVOID** พร้อมเหตุผล 3 ข้อและระยะเวลาที่คาดหวัง"""
 
-    client = genai.Client(api_key=settings.GEMINI_API_KEY)
-    response = client.models.generate_content(
+    return llm_generate(
+        prompt,
+        use_case='crew_analysis',
         model='gemini-2.5-flash-lite',
-        contents=prompt,
         config=types.GenerateContentConfig(
             temperature=0.2,
             max_output_tokens=3000,
             thinking_config=types.ThinkingConfig(thinking_budget=0),
         )
     )
-    return response.text
@@ -0,0 +1,75 @@
+# ====== cup_handle_scan.py — Cup & Handle Scanner (SET / US) บน stocks.scan_pipeline ======
+# เดิม background thread ของ cup_handle_scanner และ us_cup_handle_scanner เป็นสำเนากัน (~150 บรรทัดต่อตลาด)
+# ต่างกันจริงแค่ universe และเกณฑ์แท่งขั้นต่ำ — ตอนนี้เหลือ pipeline เดียวต่อตลาดที่ประกอบจาก CupHandleRules
+#
+# ขั้นของ pipeline:
+#   universe → bulk_fetch(600 วัน) → rs_ratings(RS 3 เดือน) → deep_evaluate(evaluate_cup_handle_symbol)
+#   → persist (CupHandleCandidate.bulk_create) → prune_history (เก็บ HISTORY_RUNS รอบล่าสุดต่อตลาด)
+#   สภาพคล่องกรองใน evaluator จากแท่งในคลัง (เดิมฝั่ง SET ยิง Yahoo summary_detail อีกรอบก่อนโหลดแท่ง)
+
+from dataclasses import dataclass
+
+from .models import CupHandleCandidate
+from .scan_evaluators import evaluate_cup_handle_symbol
+from .scan_pipeline import ScanPipeline, Stage, bulk_fetch, deep_evaluate, rs_ratings, scannable_universe, universe
+
+HISTORY_RUNS = 3
+
+
+@dataclass(frozen=True)
+class CupHandleRules:
+    universe: Stage          # SET: Top 300 ตาม Market Cap / US: ScannableSymbol
+    min_bars: int            # แท่งขั้นต่ำก่อนหารูปแบบ — SET 80 (ถ้วยของหุ้นไทยยาวกว่า) / US 60
+    min_turnover: float      # มูลค่าซื้อขายเฉลี่ย 20 วันขั้นต่ำ ในสกุลเงินของตลาด (บาท / ดอลลาร์)
+
+
+RULES = {
+    'SET': CupHandleRules(universe(limit=300), min_bars=80, min_turnover=1_000_000),
+    'US': CupHandleRules(scannable_universe(exclude=('SPY', 'QQQ', 'IWM')), min_bars=60, min_turnover=1_000_000),
+}
+
+
+def _persist(run):
+    results = run.state.get('results') or []
+    rs_map = run.state['rs_ratings']
+    run.report(97, 'บันทึกผล…')
+    objs = []
+    for r in results:
+        pat = dict(r['pat'])
+        price = pat.pop('current_price', 0.0)
+        objs.append(CupHandleCandidate(
+            user=run.user, scan_run=run.started_at, market=run.market.code, symbol=r['symbol'],
+            price=price,
+            rs_rating=rs_map.get(r['symbol'], 0),
+            adx=r['adx'], rsi=r['rsi'], avg_vol_20d=r['avg_vol'],
+            breakout_vol_ok=r['breakout_vol_ok'],
+            **pat
+        ))
+    CupHandleCandidate.objects.bulk_create(objs)
+
+
+def _prune_history(run):
+    qs = CupHandleCandidate.objects.filter(user=run.user, market=run.market.code)
+    old_runs = list(qs.values_list('scan_run', flat=True).distinct().order_by('-scan_run')[HISTORY_RUNS:])
+    if old_runs:
+        qs.filter(scan_run__in=old_runs).delete()
+
+
+def _pipeline(rules):
+    return ScanPipeline('cup_handle', [
+        rules.universe,
+        bulk_fetch(lookback_days=600),
+        rs_ratings('rs_3m_rating'),
+        deep_evaluate(evaluate_cup_handle_symbol,
+                      ctx=lambda run: {'min_bars': rules.min_bars, 'min_turnover': rules.min_turnover}),
+        Stage('persist', _persist),
+        Stage('prune_history', _prune_history),
+    ])
+
+
+PIPELINES = {market: _pipeline(rules) for market, rules in RULES.items()}
+
+
+def run_cup_handle_scan(market, user_id, job_key=None):
+    """สแกน Cup & Handle ทั้งรอบของ user — market: 'SET' / 'US' (ดู ScanPipeline.run_job)"""
+    return PIPELINES[market].run_job(market, user_id, job_key)
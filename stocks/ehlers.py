@@ -0,0 +1,196 @@
+# ====== ehlers.py — kernel ของ indicator ตระกูล John Ehlers (DSP) คอมไพล์ด้วย numba ======
+# เดิม calculate_ehlers_* ใน stocks/utils.py เป็น Python loop ทีละแท่ง และ Fisher Transform ยัง
+# slice np.max / np.min ของหน้าต่าง period ทุกแท่ง (O(n·period)) — precision scanner เรียกทั้ง 4 ตัว
+# ต่อหุ้นทุกตัว ทั้งกราฟวันและกราฟสัปดาห์
+#
+# โมดูลนี้:
+#   - kernel 1 มิติของแต่ละ indicator คอมไพล์ด้วย numba (@njit, cache ลงดิสก์ไม่ต้องคอมไพล์ใหม่ทุก process)
+#   - Fisher ใช้ monotonic deque หา max(high) / min(low) ของหน้าต่างแบบ O(n)
+#   - ehlers_batch รับ array 2 มิติ (หุ้น × แท่ง) คืนครบทุก indicator ในครั้งเดียว
+# ฟังก์ชัน calculate_ehlers_* เดิมใน utils ยังใช้ signature เดิม แค่เรียก kernel ที่นี่
+# ไม่มี numba (เช่นเครื่อง dev บางเครื่อง) → ใช้ kernel เดียวกันแบบ Python ธรรมดา ผลเท่าเดิมแต่ช้า
+
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # pragma: no cover
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
+
+
+@njit(cache=True)
+def _supersmoother_kernel(prices, period):
+    n = prices.shape[0]
+    filt = prices.copy()
+    if n < 3:
+        return filt
+    a1 = math.exp(-1.414 * 3.14159 / period)
+    b1 = 2.0 * a1 * math.cos(1.414 * 3.14159 / period)
+    c2 = b1
+    c3 = -a1 * a1
+    c1 = 1.0 - c2 - c3
+    for i in range(2, n):
+        filt[i] = c1 * (prices[i] + prices[i - 1]) / 2.0 + c2 * filt[i - 1] + c3 * filt[i - 2]
+    return filt
+
+
+@njit(cache=True)
+def _laguerre_rsi_kernel(prices, gamma):
+    n = prices.shape[0]
+    lrsi = np.zeros(n)
+    if n < 2:
+        return lrsi
+    # เก็บแค่ค่าแท่งก่อนหน้าของแต่ละ element พอ ไม่ต้องเก็บทั้ง array
+    l0 = l1 = l2 = l3 = 0.0
+    for i in range(1, n):
+        p0, p1, p2 = l0, l1, l2
+        l0 = (1.0 - gamma) * prices[i] + gamma * p0
+        l1 = -gamma * l0 + p0 + gamma * l1
+        l2 = -gamma * l1 + p1 + gamma * l2
+        l3 = -gamma * l2 + p2 + gamma * l3
+
+        cu = 0.0
+        cd = 0.0
+        if l0 >= l1:
+            cu += l0 - l1
+        else:
+            cd += l1 - l0
+        if l1 >= l2:
+            cu += l1 - l2
+        else:
+            cd += l2 - l1
+        if l2 >= l3:
+            cu += l2 - l3
+        else:
+            cd += l3 - l2
+
+        if cu + cd > 0:
+            lrsi[i] = cu / (cu + cd)
+    return lrsi
+
+
+@njit(cache=True)
+def _fisher_kernel(high, low, period):
+    n = high.shape[0]
+    fish = np.zeros(n)
+    trigger = np.zeros(n)
+    if n < period:
+        return fish, trigger
+
+    # monotonic deque ของ index (ring buffer ขนาด n): max_q เก็บ high เรียงลดลง, min_q เก็บ low เรียงเพิ่มขึ้น
+    max_q = np.empty(n, dtype=np.int64)
+    min_q = np.empty(n, dtype=np.int64)
+    max_head = max_tail = 0
+    min_head = min_tail = 0
+    value = 0.0
+    for i in range(n):
+        while max_tail > max_head and high[max_q[max_tail - 1]] <= high[i]:
+            max_tail -= 1
+        max_q[max_tail] = i
+        max_tail += 1
+        while min_tail > min_head and low[min_q[min_tail - 1]] >= low[i]:
+            min_tail -= 1
+        min_q[min_tail] = i
+        min_tail += 1
+
+        start = i - period + 1
+        if max_q[max_head] < start:
+            max_head += 1
+        if min_q[min_head] < start:
+            min_head += 1
+        if start < 0:
+            continue
+
+        maxh = high[max_q[max_head]]
+        minl = low[min_q[min_head]]
+        diff = maxh - minl
+        if diff == 0:
+            diff = 0.001
+
+        value = 0.66 * (((high[i] + low[i]) / 2.0 - minl) / diff - 0.5) + 0.67 * value
+        if value > 0.9999:
+            value = 0.9999
+        elif value < -0.9999:
+            value = -0.9999
+        prev_fish = fish[i - 1] if i > 0 else 0.0
+        fish[i] = 0.5 * math.log((1.0 + value) / (1.0 - value)) + 0.5 * prev_fish
+
+    trigger[1:] = fish[:-1]
+    return fish, trigger
+
+
+@njit(cache=True)
+def _itl_kernel(prices, alpha):
+    n = prices.shape[0]
+    itl = prices.copy()
+    if n < 3:
+        return itl
+    aa = alpha * alpha
+    c1 = alpha - aa / 4.0
+    c2 = aa / 2.0
+    c3 = alpha - 3.0 * aa / 4.0
+    d1 = 2.0 * (1.0 - alpha)
+    d2 = -((1.0 - alpha) ** 2)
+    for i in range(2, n):
+        itl[i] = c1 * prices[i] + c2 * prices[i - 1] - c3 * prices[i - 2] + d1 * itl[i - 1] + d2 * itl[i - 2]
+    return itl
+
+
+def supersmoother(prices, period=15):
+    return _supersmoother_kernel(np.ascontiguousarray(prices, dtype=np.float64), float(period))
+
+
+def laguerre_rsi(prices, gamma=0.7):
+    return _laguerre_rsi_kernel(np.ascontiguousarray(prices, dtype=np.float64), float(gamma))
+
+
+def fisher_transform(high, low, period=10):
+    return _fisher_kernel(np.ascontiguousarray(high, dtype=np.float64),
+                          np.ascontiguousarray(low, dtype=np.float64), int(period))
+
+
+def itl(prices, alpha=0.07):
+    return _itl_kernel(np.ascontiguousarray(prices, dtype=np.float64), float(alpha))
+
+
+def ehlers_batch(close, high, low, ss_period=15, gamma=0.7, fisher_period=10, itl_alpha=0.07):
+    """
+    คำนวณ indicator Ehlers ทั้ง 4 ตัวของหลายหุ้นพร้อมกัน
+    close / high / low: array 2 มิติ (หุ้น × แท่ง) หรือ 1 มิติ (หุ้นตัวเดียว) เรียงจากเก่าไปใหม่
+      หุ้นที่ประวัติสั้นกว่าตัวอื่นให้เติม NaN ไว้ด้านหน้า — แต่ละแถวเริ่มคำนวณจากแท่งแรกที่ไม่ใช่ NaN
+      (ผลเท่ากับเรียก calculate_ehlers_* กับประวัติของหุ้นตัวนั้นตรงๆ ช่วงที่เติมไว้คืนเป็น NaN)
+    Returns: dict {'supersmoother', 'laguerre_rsi', 'fisher', 'trigger', 'itl'} แต่ละตัว shape เดียวกับ close
+    """
+    close = np.asarray(close, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    single = close.ndim == 1
+    if single:
+        close, high, low = close[None, :], high[None, :], low[None, :]
+    if not (close.shape == high.shape == low.shape):
+        raise ValueError(f"close/high/low shape mismatch: {close.shape} {high.shape} {low.shape}")
+
+    out = {name: np.full(close.shape, np.nan)
+           for name in ('supersmoother', 'laguerre_rsi', 'fisher', 'trigger', 'itl')}
+    valid = ~(np.isnan(close) | np.isnan(high) | np.isnan(low))
+    has_data = valid.any(axis=1)
+    first = valid.argmax(axis=1)
+    for row in np.flatnonzero(has_data):
+        s = first[row]
+        c = np.ascontiguousarray(close[row, s:])
+        out['supersmoother'][row, s:] = _supersmoother_kernel(c, float(ss_period))
+        out['laguerre_rsi'][row, s:] = _laguerre_rsi_kernel(c, float(gamma))
+        fish, trig = _fisher_kernel(np.ascontiguousarray(high[row, s:]),
+                                    np.ascontiguousarray(low[row, s:]), int(fisher_period))
+        out['fisher'][row, s:] = fish
+        out['trigger'][row, s:] = trig
+        out['itl'][row, s:] = _itl_kernel(c, float(itl_alpha))
+
+    if single:
+        out = {name: arr[0] for name, arr in out.items()}
+    return out
@@ -11,14 +11,20 @@
 #
 # ตั้ง cron ให้รันคำสั่งนี้เป็นระยะ (เช่นทุก 5 นาที) — ไม่ต้องกังวลเรื่องเวลาตลาดปิด เพราะ
 # evaluate_user_alerts() เช็ค is_market_open() ต่อ position ในพอร์ตอยู่แล้วก่อนสร้าง SL/TP/Breakout alert
+#
+# หรือรันเป็น background evaluator ค้างไว้ด้วย --loop (เช็คทุก --interval วินาที) แทน cron ก็ได้
+# คำสั่งนี้เป็นทางเดียวที่ประเมิน alert ให้ทุกหน้า — context processor (stocks.context_processors)
+# แค่อ่านสรุป unread จาก cache ที่ evaluate_user_alerts()/refresh_unread_alert_state() เขียนไว้
+# ไม่ดึงราคาเองระหว่าง render หน้าอีกแล้ว
 
+import time
 from datetime import timedelta
 
 from django.core.cache import cache
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
-from stocks.alert_engine import evaluate_user_alerts
+from stocks.alert_engine import evaluate_user_alerts, refresh_unread_alert_state
 from stocks.models import StockAlertConfig, StockAlertEvent
 from stocks.views.alerts import _LAST_RUN_CACHE_KEY
 
@@ -33,7 +39,26 @@ class Command(BaseCommand):
         'พร้อมลบประวัติแจ้งเตือนเก่ากว่าที่ตั้งไว้ทิ้งด้วย — สำหรับตั้ง cron รันเป็นระยะ'
     )
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='รันค้างไว้เป็น background evaluator (ไม่ต้องตั้ง cron)')
+        parser.add_argument('--interval', type=int, default=60, help='ระยะห่างระหว่างรอบ (วินาที) เมื่อใช้ --loop')
+
+    def handle(self, *args, **options):
+        if not options.get('loop'):
+            self._run_once()
+            return
+
+        interval = max(int(options.get('interval') or 60), 10)
+        self.stdout.write(self.style.SUCCESS(f"--- Alert evaluator เริ่มทำงาน (ทุก {interval} วินาที) ---"))
+        while True:
+            try:
+                self._run_once()
+            except Exception as e:
+                # รอบนี้พัง (เช่น DB หลุดชั่วคราว) ก็รอรอบถัดไป ไม่ให้ evaluator ตายทั้งตัว
+                self.stdout.write(self.style.ERROR(f"evaluator error: {e}"))
+            time.sleep(interval)
+
+    def _run_once(self):
         configs = StockAlertConfig.objects.filter(enabled=True).select_related('user')
         checked = 0
         total_events = 0
@@ -72,6 +97,7 @@ class Command(BaseCommand):
             cache.set(cleanup_key, True, timeout=_CLEANUP_INTERVAL_SECONDS)
 
             if deleted:
+                refresh_unread_alert_state(config.user)
                 deleted_total += deleted
                 self.stdout.write(self.style.WARNING(
                     f"[{config.user.username}] ลบแจ้งเตือนที่เก่ากว่า {config.alert_retention_days} วัน จำนวน {deleted} รายการ"
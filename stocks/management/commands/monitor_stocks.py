@@ -4,7 +4,7 @@ from django.core.cache import cache
 from stocks.models import Watchlist, Portfolio, UserTelegramProfile, PrecisionScanCandidate
 from stocks.telegram_utils import send_telegram_message
 from stocks.utils import simple_trailing_stop
-import yfinance as yf
+from stocks.quote_service import get_live_prices
 import time
 
 class Command(BaseCommand):
@@ -40,18 +40,15 @@ class Command(BaseCommand):
             else:
                 yf_symbols.append(sym)
                 
-        self.stdout.write(f"📊 กำลังดึงราคาสดจาก YFinance: {yf_symbols}")
+        self.stdout.write(f"📊 กำลังดึงราคาสดจาก Yahoo: {yf_symbols}")
         try:
-            # ดึงข้อมูลรวดเดียว
-            tickers = yf.Tickers(" ".join(yf_symbols))
-            live_prices = {}
-            for original_sym, yf_sym in zip(symbols_to_check, yf_symbols):
-                try:
-                    price = tickers.tickers[yf_sym].info.get('currentPrice') or tickers.tickers[yf_sym].fast_info.last_price
-                    if price:
-                        live_prices[original_sym] = price
-                except Exception as e:
-                    pass
+            # ดึงข้อมูลรวดเดียวผ่าน quote_service (batch + cache ร่วมกับหน้าเว็บ)
+            prices = get_live_prices(yf_symbols)
+            live_prices = {
+                original_sym: prices[yf_sym]
+                for original_sym, yf_sym in zip(symbols_to_check, yf_symbols)
+                if yf_sym in prices
+            }
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Error fetching prices: {e}"))
             return
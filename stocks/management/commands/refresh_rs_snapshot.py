@@ -0,0 +1,26 @@
+"""
+python manage.py refresh_rs_snapshot [--market SET --market US]
+
+คำนวณ RS Rating ของทุก ScannableSymbol ในตลาดแล้วเก็บลง RelativeStrengthSnapshot (stocks/rs_engine.py)
+รันวันละครั้งหลังตลาดปิด — scanner ทุกตัวอ่าน snapshot นี้ ไม่ต้องคำนวณ RS เองตอนผู้ใช้กดสแกน
+(ถ้าไม่ได้ตั้ง cron ไว้ scanner ตัวแรกของวันจะคำนวณให้เองหนึ่งครั้ง)
+"""
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'คำนวณ RS Rating รายวันของทั้งตลาด (RelativeStrengthSnapshot)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--market', action='append', choices=['SET', 'US'],
+                            help='ตลาดที่ต้องการ (ใส่ซ้ำได้, default ทั้ง SET และ US)')
+
+    def handle(self, *args, **options):
+        from stocks.rs_engine import build_snapshot
+
+        for market in options['market'] or ['SET', 'US']:
+            as_of = build_snapshot(market)
+            if as_of:
+                self.stdout.write(self.style.SUCCESS(f'{market}: snapshot {as_of}'))
+            else:
+                self.stdout.write(self.style.WARNING(f'{market}: ไม่มีข้อมูลราคา — ข้าม'))
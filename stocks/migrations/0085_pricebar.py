@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0084_precisionscancandidate_vp_poc_price_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=20)),
+                ('interval', models.CharField(default='1d', max_length=5)),
+                ('date', models.DateField()),
+                ('open', models.FloatField()),
+                ('high', models.FloatField()),
+                ('low', models.FloatField()),
+                ('close', models.FloatField()),
+                ('volume', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Price Bar',
+                'verbose_name_plural': 'Price Bars',
+                'unique_together': {('symbol', 'interval', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0086_scanjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='precisionscancandidate',
+            name='vp_hvn',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='precisionscancandidate',
+            name='vp_lvn',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='precisionscancandidate',
+            name='vp_profiles',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='precisionscancandidate',
+            name='vp_vah',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='precisionscancandidate',
+            name='vp_val',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
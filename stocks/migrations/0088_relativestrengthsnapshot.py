@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0087_precisionscancandidate_volume_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelativeStrengthSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('market', models.CharField(max_length=10)),
+                ('symbol', models.CharField(max_length=20)),
+                ('date', models.DateField()),
+                ('ret_1m', models.FloatField(blank=True, null=True)),
+                ('ret_3m', models.FloatField(blank=True, null=True)),
+                ('ret_6m', models.FloatField(blank=True, null=True)),
+                ('ret_12m', models.FloatField(blank=True, null=True)),
+                ('rs_score', models.FloatField(blank=True, null=True)),
+                ('rs_rating', models.IntegerField(default=0)),
+                ('rs_3m_rating', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Relative Strength Snapshot',
+                'verbose_name_plural': 'Relative Strength Snapshots',
+                'indexes': [models.Index(fields=['market', 'date', 'rs_rating'], name='stocks_rela_market_c5d5ca_idx')],
+                'unique_together': {('market', 'date', 'symbol')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks', '0088_relativestrengthsnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='relativestrengthsnapshot',
+            name='rs_rating',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='relativestrengthsnapshot',
+            name='rs_3m_rating',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
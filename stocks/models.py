@@ -442,6 +442,11 @@ class PrecisionScanCandidate(models.Model):
     ichimoku_kumo_green = models.BooleanField(default=False)      # Kumo อนาคตเป็นสีเขียว (SpanA > SpanB)
     vp_poc_price = models.FloatField(null=True, blank=True)
     vp_status = models.CharField(max_length=20, blank=True)
+    vp_vah = models.FloatField(null=True, blank=True)                     # Value Area High (70%) ของ 120 แท่ง
+    vp_val = models.FloatField(null=True, blank=True)                     # Value Area Low (70%) ของ 120 แท่ง
+    vp_hvn = models.JSONField(default=list, blank=True)                   # High Volume Nodes (ราคา, เรียงตาม volume)
+    vp_lvn = models.JSONField(default=list, blank=True)                   # Low Volume Nodes (ราคา)
+    vp_profiles = models.JSONField(default=dict, blank=True)              # {"20": {poc, vah, val, ...}, "60": ..., "250": ...}
     ichimoku_chikou_ok  = models.BooleanField(default=False)      # Chikou อยู่เหนือราคา 26 แท่งก่อน
     ichimoku_score      = models.IntegerField(default=0)          # คะแนนรวม Ichimoku (0-4)
 
@@ -1449,3 +1454,92 @@ class StockAlertEvent(models.Model):
     def __str__(self):
         return f"{self.get_alert_type_display()}: {self.symbol} ({self.user.username})"
 
+
+
+# ====== PriceBar — คลังแท่งราคา OHLCV ในเครื่อง (ใช้ร่วมกันทุก scanner) ======
+
+class PriceBar(models.Model):
+    """
+    แท่งราคา OHLCV หนึ่งแท่งต่อ (symbol, interval, date) — เป็นคลังกลางที่ stocks/bar_store.py ดูแล
+    scanner ทุกตัวอ่านจากตารางนี้แทนการดึงประวัติเต็มจาก Yahoo ทุกครั้ง แล้วค่อยเติมเฉพาะแท่งท้ายที่ขาด
+    ราคาเป็นแบบ auto-adjusted (ปรับปันผล/แตกพาร์แล้ว) ให้ตรงกับค่า default ของ yf.Ticker().history()
+    """
+    # symbol ตามรูปแบบ Yahoo เลย (PTT.BK, AAPL, ^SET.BK) — ไม่ต้องเดาตลาดซ้ำตอนอ่าน
+    symbol = models.CharField(max_length=20)
+    # ช่วงเวลาของแท่ง เช่น '1d', '1wk'
+    interval = models.CharField(max_length=5, default='1d')
+    date = models.DateField()
+    open = models.FloatField()
+    high = models.FloatField()
+    low = models.FloatField()
+    close = models.FloatField()
+    volume = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('symbol', 'interval', 'date')
+        verbose_name = "Price Bar"
+        verbose_name_plural = "Price Bars"
+
+    def __str__(self):
+        return f"{self.symbol} [{self.interval}] {self.date}: {self.close}"
+
+
+# ====== ScanJob — สถานะงานสแกนเบื้องหลัง (แทนการเขียน progress ลง DatabaseCache ทุก symbol) ======
+
+class ScanJob(models.Model):
+    """
+    สถานะล่าสุดของงานสแกนเบื้องหลัง 1 งานต่อ key (เช่น precision_scan_<user_id>) — stocks/scan_jobs.py ดูแล
+    progress ระหว่างสแกนเก็บในหน่วยความจำของ process ที่รันงาน แล้วค่อยเขียนลงตารางนี้แบบรวบ (coalesced)
+    เพื่อให้ process อื่นอ่านได้ / ใช้เป็น lock กันกดสแกนซ้อน และ push ไปหน้าเว็บผ่าน Channels WebSocket
+    """
+    key = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='scan_jobs')
+    # 'running' / 'done' / 'idle' — ตรงกับ field state ใน status dict ที่หน้าเว็บ poll อยู่เดิม
+    state = models.CharField(max_length=10, default='idle')
+    # dict สถานะเต็มที่ส่งให้หน้าเว็บ (progress, total, phase, count, error ฯลฯ)
+    status = models.JSONField(default=dict, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Scan Job"
+        verbose_name_plural = "Scan Jobs"
+
+    def __str__(self):
+        return f"{self.key}: {self.state}"
+
+
+# ====== RelativeStrengthSnapshot — RS Rating รายวันของทั้งตลาด (คำนวณครั้งเดียว ใช้ร่วมทุก scanner) ======
+
+class RelativeStrengthSnapshot(models.Model):
+    """
+    RS Rating แบบ cross-sectional ของทุก ScannableSymbol ในตลาด ณ วันทำการหนึ่ง — stocks/rs_engine.py ดูแล
+    เดิม scanner แต่ละตัว rank ผลตอบแทนเองทุกครั้งที่กดสแกน (และคนละ universe / คนละสูตร)
+    ตอนนี้คำนวณรวดเดียวทั้งตลาดวันละครั้ง แล้วทุก scanner / Trend Template / Sector dashboard อ่านจากตารางนี้
+    """
+    market = models.CharField(max_length=10)
+    # symbol แบบไม่มี suffix (PTT, AAPL) — ตรงกับ ScannableSymbol.symbol และ field symbol ของตาราง candidate
+    symbol = models.CharField(max_length=20)
+    # วันที่ของแท่งล่าสุดที่ใช้คำนวณ (วันทำการ)
+    date = models.DateField()
+    # ผลตอบแทนย้อนหลัง (%) — 1m = 22 แท่ง, 3m = 66, 6m = 127, 12m = 253 (null = ประวัติไม่พอ)
+    ret_1m = models.FloatField(null=True, blank=True)
+    ret_3m = models.FloatField(null=True, blank=True)
+    ret_6m = models.FloatField(null=True, blank=True)
+    ret_12m = models.FloatField(null=True, blank=True)
+    # ผลตอบแทนถ่วงน้ำหนักแบบ IBD (ไตรมาสล่าสุด 40% + 3 ไตรมาสก่อนหน้า 20% ต่อไตรมาส)
+    rs_score = models.FloatField(null=True, blank=True)
+    # percentile 0-99 ของ rs_score ทั้งตลาด (IBD / Minervini RS Rating) — null = ประวัติไม่ถึง 4 ไตรมาส
+    rs_rating = models.IntegerField(null=True, blank=True)
+    # percentile 0-99 ของ ret_3m ทั้งตลาด — สูตรที่ Precision / Momentum / Cup & Handle ใช้มาตลอด (null = ไม่ถึง 66 แท่ง)
+    rs_3m_rating = models.IntegerField(null=True, blank=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('market', 'date', 'symbol')
+        indexes = [models.Index(fields=['market', 'date', 'rs_rating'])]
+        verbose_name = "Relative Strength Snapshot"
+        verbose_name_plural = "Relative Strength Snapshots"
+
+    def __str__(self):
+        return f"{self.symbol} [{self.market}] {self.date}: RS {self.rs_rating}"
@@ -0,0 +1,155 @@
+# ====== momentum_scan.py — Momentum Scanner (SET / US) บน stocks.scan_pipeline ======
+# เดิม background thread ของ momentum_scanner และ us_momentum_scanner เขียนแยกกันคนละชุด (~200 บรรทัดต่อตลาด)
+# ทั้งที่ขั้นตอนเหมือนกัน: โหลดแท่ง → RS → ประเมินทีละหุ้น → บันทึก MomentumCandidate
+# ตอนนี้เหลือ pipeline เดียวต่อตลาดที่ประกอบจาก MomentumRules — เกณฑ์ที่ต่างกันจริงเป็น field ของ rules
+#
+# ขั้นของ pipeline:
+#   universe → bulk_fetch(600 วัน) → index_returns → rs_ratings → liquidity_screen
+#   → deep_evaluate(rules.evaluate) → fundamentals (เฉพาะ rules.with_fundamentals) → persist
+#   สภาพคล่องวัดจากแท่งในคลัง (เดิมฝั่ง SET ยิง Yahoo price ทีละ 100 ตัวอีกรอบก่อนโหลดแท่ง)
+
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db import transaction
+
+from .models import MomentumCandidate
+from .scan_evaluators import evaluate_momentum_symbol, evaluate_us_momentum_symbol
+from .scan_pipeline import (
+    ScanPipeline, Stage, bulk_fetch, deep_evaluate, fundamentals, index_returns, rs_ratings, universe,
+)
+
+# ดัชนี/ETF ที่อยู่ในรายชื่อ US ชุดมาตรฐาน — ใช้เป็นตัวเทียบ ไม่ใช่หุ้นที่จะคัด
+INDEX_ETFS = ('SPY', 'QQQ', 'IWM')
+
+
+@dataclass(frozen=True)
+class MomentumRules:
+    universe: Stage                  # SET: Top 300 ตาม Market Cap / US: รายชื่อ Nasdaq-S&P ชุดมาตรฐาน
+    evaluate: Callable               # SET: RSI ≥ 35 (ผ่อนได้) / US: Trend Template + Volume ≥ 500K หุ้น/วัน
+    rs_field: str                    # SET: RS 3 เดือน / US: RS แบบ IBD 4 ไตรมาส
+    min_turnover: float = 0          # มูลค่าซื้อขายเฉลี่ย 20 วันขั้นต่ำก่อนเจาะลึก (0 = ไม่กรองขั้นนี้)
+    max_candidates: int = 0          # เจาะลึกไม่เกินกี่ตัวแรกตามลำดับ universe (0 = ทั้งหมด)
+    with_fundamentals: bool = False  # ดึง Sector / EPS / Revenue growth ของหุ้นที่ผ่าน (yahooquery)
+
+
+def _curated_us_universe():
+    def _universe(run):
+        from .views.base import _US_MOMENTUM_SYMBOLS
+
+        run.state['symbols'] = [s for s in _US_MOMENTUM_SYMBOLS if s not in INDEX_ETFS]
+
+    return Stage('universe', _universe)
+
+
+RULES = {
+    'SET': MomentumRules(universe(limit=300), evaluate_momentum_symbol, 'rs_3m_rating',
+                         min_turnover=150_000, max_candidates=150, with_fundamentals=True),
+    'US': MomentumRules(_curated_us_universe(), evaluate_us_momentum_symbol, 'rs_rating'),
+}
+
+
+def _liquidity_screen(rules):
+    """
+    ตัดหุ้นที่มูลค่าซื้อขายเฉลี่ย 20 วันต่ำกว่า rules.min_turnover → run.state['candidates']
+    ตัวที่ยังไม่มีแท่งให้ผ่านไปให้ evaluator ตัดสินเอง / ผ่านน้อยกว่า 20 ตัว (ข้อมูลราคาล่ม) ใช้ทั้ง universe
+    """
+    def _screen(run):
+        symbols = run.state['symbols']
+        if rules.min_turnover:
+            bars = run.state['bars']
+            passed = []
+            for symbol in symbols:
+                df = bars.get(run.market.yahoo(symbol))
+                if df is None or df.empty:
+                    passed.append(symbol)
+                    continue
+                tail = df.tail(20)
+                if float((tail['Close'] * tail['Volume']).mean()) >= rules.min_turnover:
+                    passed.append(symbol)
+            if len(passed) >= 20:
+                symbols = passed
+        if rules.max_candidates:
+            symbols = symbols[:rules.max_candidates]
+        run.state['candidates'] = symbols
+
+    return Stage('liquidity_screen', _screen)
+
+
+def _evaluate_ctx(run):
+    return {
+        'rs_ratings': {s: run.state['rs_ratings'][s] for s in run.state['candidates'] if s in run.state['rs_ratings']},
+        'spy_1m': run.state['index_1m_return'],
+        'spy_3m': run.state['index_3m_return'],
+    }
+
+
+def _candidate(run, r, f):
+    sym = r['symbol']
+    return MomentumCandidate(
+        user=run.user,
+        market=run.market.code,
+        symbol=sym,
+        symbol_bk=run.market.yahoo(sym),
+        sector=f.get('sector') or r.get('sector') or 'Unknown',
+        price=r['price'],
+        rsi=r['rsi'],
+        adx=r['adx'],
+        mfi=r['mfi'],
+        rvol=r['rvol'],
+        rvol_bullish=r.get('rvol_bullish', False),
+        eps_growth=f.get('eps_growth', 0.0),
+        rev_growth=f.get('rev_growth', 0.0),
+        technical_score=r['technical_score'],
+        rs_rating=run.state['rs_ratings'].get(sym, 0),
+        stage2=r.get('stage2', False),
+        macd_crossover=r.get('macd_crossover', False),
+        bb_squeeze=r.get('bb_squeeze', False),
+        rel_1m=r.get('rel_1m', 0.0),
+        rel_3m=r.get('rel_3m', 0.0),
+        entry_strategy=r.get('entry_strategy', ''),
+        demand_zone_start=r.get('demand_zone_start'),
+        demand_zone_end=r.get('demand_zone_end'),
+        supply_zone_start=r.get('supply_zone_start'),
+        supply_zone_end=r.get('supply_zone_end'),
+        stop_loss=r.get('stop_loss'),
+        risk_reward_ratio=r.get('risk_reward_ratio'),
+        year_high=r.get('year_high', 0.0),
+        upside_to_high=r.get('upside_to_high', 0.0),
+        zone_proximity=r.get('zone_proximity', 999.0),
+    )
+
+
+def _persist(run):
+    # แทนผลรอบก่อนทั้งชุดใน transaction เดียว — หน้า scanner ไม่เห็นตารางว่างระหว่างบันทึก
+    fund_data = run.state.get('fundamentals') or {}
+    run.report(97, 'บันทึกผล…')
+    with transaction.atomic():
+        MomentumCandidate.objects.filter(user=run.user, market=run.market.code).delete()
+        MomentumCandidate.objects.bulk_create(
+            [_candidate(run, r, fund_data.get(r['symbol'], {})) for r in run.state.get('results') or []],
+            ignore_conflicts=True,
+        )
+
+
+def _pipeline(rules):
+    stages = [
+        rules.universe,
+        bulk_fetch(lookback_days=600),
+        index_returns(),
+        rs_ratings(rules.rs_field),
+        _liquidity_screen(rules),
+        deep_evaluate(rules.evaluate, ctx=_evaluate_ctx),
+    ]
+    if rules.with_fundamentals:
+        stages.append(fundamentals())
+    stages.append(Stage('persist', _persist))
+    return ScanPipeline('momentum', stages)
+
+
+PIPELINES = {market: _pipeline(rules) for market, rules in RULES.items()}
+
+
+def run_momentum_scan(market, user_id, job_key=None):
+    """สแกน Momentum ทั้งรอบของ user — market: 'SET' / 'US' (ดู ScanPipeline.run_job)"""
+    return PIPELINES[market].run_job(market, user_id, job_key)
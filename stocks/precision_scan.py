@@ -0,0 +1,218 @@
+# ====== precision_scan.py — Precision Momentum Scanner (SET / US) บน stocks.scan_pipeline ======
+# เดิม background thread ของ precision_momentum_scanner และ us_precision_scanner เป็นสำเนากันเกือบทั้งฟังก์ชัน
+# (~300 บรรทัดต่อตลาด) — ตอนนี้เหลือ pipeline เดียว ต่างกันแค่ MarketSpec ที่ส่งเข้ามา
+#
+# ขั้นของ pipeline:
+#   universe(400) → bulk_fetch(600 วัน) → index_returns → rs_prefilter(RS >= 45)
+#   → deep_evaluate(evaluate_precision_symbol) → fundamentals → sector_confirmation
+#   → persist (PrecisionScanCandidate.bulk_create) → prune_history (เก็บ 3 วันล่าสุด)
+
+import logging
+from collections import defaultdict
+
+import pandas as pd
+from django.utils import timezone as dj_timezone
+
+from .models import PrecisionScanCandidate
+from .scan_evaluators import evaluate_precision_symbol
+from .scan_pipeline import (
+    ScanPipeline, Stage, bulk_fetch, deep_evaluate, fundamentals, index_returns, rs_prefilter, universe,
+)
+
+logger = logging.getLogger(__name__)
+
+# เก็บประวัติสแกนไว้กี่ "วัน" (ไม่ใช่กี่ครั้ง) — POC Trend ในหน้า scanner ต้องข้ามวันได้
+HISTORY_DAYS = 3
+
+
+def _sector_confirmation(run):
+    """
+    Sector Confirmation (Livermore "Leading Sisters") — % ของหุ้นใน sector เดียวกันที่อยู่ Stage 2
+    หุ้นกลุ่มเดียวกันควรขยับไปด้วยกัน ถ้าหุ้นตัวนำวิ่งเดี่ยวๆ แต่กลุ่มไม่ขยับ มีโอกาสเป็นสัญญาณหลอกสูงขึ้น
+    → run.state['sector_stage2_ratio'] ({sector: %})
+    """
+    fund_data = run.state.get('fundamentals') or {}
+    sec_total = defaultdict(int)
+    sec_stage2 = defaultdict(int)
+    for rec in run.state.get('results') or []:
+        sec = fund_data.get(rec['symbol'], {}).get('sector') or 'Unknown'
+        sec_total[sec] += 1
+        if rec.get('stage2'):
+            sec_stage2[sec] += 1
+    run.state['sector_stage2_ratio'] = {
+        sec: round(sec_stage2[sec] / tot * 100, 1) if tot else 0.0 for sec, tot in sec_total.items()
+    }
+
+
+def _previous_symbols(user, market):
+    prev_run = (
+        PrecisionScanCandidate.objects
+        .filter(user=user, market=market)
+        .values_list('scan_run', flat=True)
+        .order_by('-scan_run')
+        .distinct()
+        .first()
+    )
+    if not prev_run:
+        return set()
+    return set(
+        PrecisionScanCandidate.objects
+        .filter(user=user, scan_run=prev_run)
+        .values_list('symbol', flat=True)
+    )
+
+
+def _candidate(run, r, f, sector_pct, prev_symbols):
+    sym = r['symbol']
+    vcp = r.get('vcp', {})
+    return PrecisionScanCandidate(
+        user=run.user,
+        market=run.market.code,
+        scan_run=run.started_at,
+        symbol=sym,
+        symbol_bk=run.market.yahoo(sym),
+        sector=f.get('sector') or 'Unknown',
+        trend_template_score=r.get('trend_template_score', 0),
+        trend_template_passed=r.get('trend_template_passed', False),
+        cheat_entry=r.get('cheat_entry', False),
+        sector_confirmed=sector_pct >= 30.0,
+        sector_strength_pct=sector_pct,
+        price=r['price'],
+        rsi=r['rsi'],
+        adx=r['adx'],
+        mfi=r['mfi'],
+        rvol=r['rvol'],
+        eps_growth=round(f.get('eps_growth', 0), 2),
+        rev_growth=round(f.get('rev_growth', 0), 2),
+        technical_score=r['technical_score'],
+        rs_rating=r['rs_rating'],
+        avg_volume_20d=r['avg_volume_20d'],
+        rvol_bullish=r['rvol_bullish'],
+        erc_volume_confirmed=r['erc_volume_confirmed'],
+        zone_target_source=r['zone_target_src'],
+        is_new_entry=(sym not in prev_symbols),
+        entry_strategy=r['entry_strat'],
+        demand_zone_start=r['dz_start'],
+        demand_zone_end=r['dz_end'],
+        supply_zone_start=r['sz_start'],
+        supply_zone_end=r['sz_end'],
+        stop_loss=r['sl_price'],
+        risk_reward_ratio=r['rr_val'],
+        year_high=r['year_high'],
+        upside_to_high=r['upside_to_high'],
+        zone_proximity=r['prox_val'],
+        price_pattern=r['pattern_name'],
+        price_pattern_score=r['pattern_score'],
+        rel_momentum_1m=r['rel_1m'],
+        rel_momentum_3m=r['rel_3m'],
+        macd_histogram=r['macd_histogram'],
+        macd_crossover=r['macd_crossover'],
+        bb_squeeze=r['bb_squeeze'],
+        ema20_aligned=r['ema20_aligned'],
+        ema20_slope=r.get('ema20_slope', 0.0),
+        ema20_rising=r.get('ema20_rising', False),
+        hh_hl_structure=r.get('hh_hl_structure', False),
+        stage2=r.get('stage2', False),
+        pocket_pivot=r.get('pocket_pivot', False),
+        pp_at_ma50=r.get('pp_at_ma50', False),
+        wyckoff_spring=r.get('wyckoff_spring', False),
+        wyckoff_upthrust=r.get('wyckoff_upthrust', False),
+        wyckoff_effort_result_warning=r.get('wyckoff_effort_result_warning', False),
+        wyckoff_selling_climax=r.get('wyckoff_selling_climax', False),
+        ma10=r.get('ma10', 0.0),
+        ma50=r.get('ma50', 0.0),
+        vdu_near_zone=r.get('vdu_near_zone', False),
+        cmf=r.get('cmf', None),
+        is_52w_breakout=r.get('is_52w_breakout', False),
+        volume_surge=r.get('volume_surge', 1.0),
+        is_volume_surge=r.get('is_volume_surge', False),
+        ichimoku_above_kumo=r.get('ichimoku_above_kumo', False),
+        ichimoku_tk_cross=r.get('ichimoku_tk_cross', False),
+        ichimoku_kumo_green=r.get('ichimoku_kumo_green', False),
+        ichimoku_chikou_ok=r.get('ichimoku_chikou_ok', False),
+        ichimoku_score=r.get('ichimoku_score', 0),
+        # VCP v9
+        vcp_setup=vcp.get('setup', False),
+        vcp_contractions=vcp.get('contractions', 0),
+        vcp_tightness=vcp.get('tightness', 0.0),
+        vcp_vdu=vcp.get('vdu_confirmed', False),
+        base_length_weeks=vcp.get('base_length_weeks', 0),
+        # Launcher v10
+        launcher_score=r.get('launcher_score', 0),
+        turtle_dist_pct=r.get('turtle_dist_pct', 99.0),
+        is_explosive=r.get('is_explosive', False),
+        tightness_idx=r.get('tightness_idx', 99.0),
+        # Pre-Breakout Signals v13
+        inside_bar=r.get('inside_bar', False),
+        acc_days=r.get('acc_days', 0),
+        dist_days=r.get('dist_days', 0),
+        # Ehlers v12
+        ehlers_supersmoother=r.get('ehlers_supersmoother', None),
+        ehlers_laguerre_rsi=r.get('ehlers_laguerre_rsi', None),
+        ehlers_fisher=r.get('ehlers_fisher', None),
+        ehlers_fisher_trigger=r.get('ehlers_fisher_trigger', None),
+        ehlers_itl_daily=r.get('ehlers_itl_daily', None),
+        ehlers_itl_weekly=r.get('ehlers_itl_weekly', None),
+        ehlers_itl_bullish=r.get('ehlers_itl_bullish', False),
+        vp_poc_price=r.get('vp_poc_price'),
+        vp_status=r.get('vp_status') or '',
+        vp_vah=r.get('vp_vah'),
+        vp_val=r.get('vp_val'),
+        vp_hvn=r.get('vp_hvn') or [],
+        vp_lvn=r.get('vp_lvn') or [],
+        vp_profiles=r.get('vp_profiles') or {},
+    )
+
+
+def _persist(run):
+    results = run.state.get('results') or []
+    if not results:
+        return
+    scan_df = pd.DataFrame(results)
+    if 'rs_rating' not in scan_df.columns:
+        scan_df['rs_rating'] = 0
+
+    fund_data = run.state.get('fundamentals') or {}
+    sector_ratio = run.state.get('sector_stage2_ratio') or {}
+    prev_symbols = _previous_symbols(run.user, run.market.code)
+    bulk_candidates = []
+    for r in scan_df.to_dict('records'):
+        f = fund_data.get(r['symbol'], {'sector': 'N/A', 'eps_growth': 0.0, 'rev_growth': 0.0})
+        sector_pct = sector_ratio.get(f.get('sector') or 'Unknown', 0.0)
+        bulk_candidates.append(_candidate(run, r, f, sector_pct, prev_symbols))
+    PrecisionScanCandidate.objects.bulk_create(bulk_candidates)
+
+
+def _prune_history(run):
+    # เก็บประวัติแค่ HISTORY_DAYS "วัน" ล่าสุด (ไม่ใช่จำนวนครั้ง) — ถ้านับเป็นครั้ง คนที่สแกนวันละหลายรอบ
+    # จะไล่ลบประวัติของวันก่อนๆ หมดภายในวันเดียว ทำให้ POC Trend ไม่มีทางข้ามวันได้เลย
+    qs = PrecisionScanCandidate.objects.filter(user=run.user, market=run.market.code)
+    all_runs = list(qs.values_list('scan_run', flat=True).order_by('-scan_run').distinct())
+    seen_dates = []
+    for ts in all_runs:
+        d = dj_timezone.localtime(ts).date()
+        if d not in seen_dates:
+            seen_dates.append(d)
+    if len(seen_dates) > HISTORY_DAYS:
+        cutoff = seen_dates[HISTORY_DAYS - 1]  # วันที่เก่าที่สุดที่จะเก็บไว้
+        old_runs = [ts for ts in all_runs if dj_timezone.localtime(ts).date() < cutoff]
+        if old_runs:
+            qs.filter(scan_run__in=old_runs).delete()
+
+
+PRECISION_PIPELINE = ScanPipeline('precision', [
+    universe(limit=400),
+    bulk_fetch(lookback_days=600),  # ~430 แท่ง — EMA200 มี warm-up พอ
+    index_returns(),
+    rs_prefilter(min_rating=45),    # ผ่อนปรนให้ RS >= 45 เข้าประเมิน เพื่อจับ Early Accumulation ได้
+    deep_evaluate(evaluate_precision_symbol),
+    fundamentals(),
+    Stage('sector_confirmation', _sector_confirmation),
+    Stage('persist', _persist),
+    Stage('prune_history', _prune_history),
+])
+
+
+def run_precision_scan(market, user_id, job_key=None):
+    """สแกน Precision Momentum ทั้งรอบของ user — market: 'SET' / 'US' (ดู ScanPipeline.run_job)"""
+    return PRECISION_PIPELINE.run_job(market, user_id, job_key)
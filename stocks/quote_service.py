@@ -0,0 +1,176 @@
+# ====== quote_service.py — ราคาล่าสุดแบบ batch ที่ทุกหน้า/คำสั่งใช้ร่วมกัน ======
+# เดิมแต่ละจุดดึงราคาสดเองทีละตัว: alert_engine/monitor_stocks ใช้ yf.Tickers(...).info (quoteSummary เต็มก้อน
+# ต่อ 1 ตัว — ช้าที่สุดที่ Yahoo มี) ส่วน scanner/portfolio ใช้ fast_info ผ่าน ThreadPool ทีละ symbol
+#
+# โมดูลนี้รวมเป็นที่เดียว:
+#   - ดึง last price / previous close / market cap ของ N ตัวด้วย yahooquery `price` ครั้งเดียวต่อ chunk
+#     (ตัวที่ yahooquery ไม่คืนค่า → yf.download 5 วันก้อนเดียวเป็น fallback ได้แค่ราคา/ราคาปิดก่อนหน้า)
+#   - cache ต่อ symbol ด้วย TTL สั้นตอนตลาดเปิด / ยาวตอนตลาดปิด (ตาม is_market_open)
+#   - symbol เดียวกันที่ถูกขอพร้อมกันหลาย request/หลาย user ใน process เดียว → ยิง Yahoo ครั้งเดียว
+#     คนที่มาทีหลังรอผลจากคนแรกแล้วอ่านจาก cache
+#
+# ใช้งาน: get_quotes(['PTT.BK', 'AAPL']) → {'PTT.BK': {'price': .., 'prev_close': .., 'market_cap': ..}, ...}
+# symbol ใช้รูปแบบ Yahoo ตรงๆ (เติม .BK เอง) เหมือน bar_store
+
+import logging
+import threading
+from collections import defaultdict
+
+import pandas as pd
+import yfinance as yf
+from django.core.cache import cache
+
+from .bar_store import _market_of
+
+logger = logging.getLogger(__name__)
+
+_QUOTE_CACHE_KEY = 'quote_{symbol}'
+_QUOTE_TTL_MARKET_OPEN = 30
+_QUOTE_TTL_MARKET_CLOSED = 15 * 60
+# yahooquery price ทีละกี่ symbol ต่อ request
+_FETCH_CHUNK = 100
+# รอ request อื่นที่กำลังดึง symbol เดียวกันอยู่ได้นานสุดกี่วินาที ก่อนยอมคืนค่าว่าง
+_INFLIGHT_WAIT_SECONDS = 20
+
+_inflight_lock = threading.Lock()
+_inflight = {}  # symbol → threading.Event ของ request ที่กำลังดึง symbol นั้นอยู่
+
+
+def _to_float(v):
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if f == f and f > 0 else None  # ตัด NaN / 0 / ค่าติดลบ
+
+
+def _fetch_yq(symbols):
+    """yahooquery Ticker(...).price — 1 request ต่อ chunk คืน {symbol: quote}"""
+    from yahooquery import Ticker as YQTicker
+
+    out = {}
+    for i in range(0, len(symbols), _FETCH_CHUNK):
+        chunk = symbols[i:i + _FETCH_CHUNK]
+        try:
+            data = YQTicker(chunk, timeout=20).price
+        except Exception as e:
+            logger.warning("quote_service yahooquery chunk failed (%d symbols): %s", len(chunk), e)
+            continue
+        if not isinstance(data, dict):
+            continue
+        for sym in chunk:
+            row = data.get(sym)
+            if not isinstance(row, dict):
+                continue  # yahooquery คืน string error แทน dict เมื่อหา symbol ไม่เจอ
+            price = _to_float(row.get('regularMarketPrice'))
+            if price is None:
+                continue
+            out[sym] = {
+                'price': price,
+                'prev_close': _to_float(row.get('regularMarketPreviousClose')),
+                'market_cap': _to_float(row.get('marketCap')),
+            }
+    return out
+
+
+def _fetch_yf(symbols):
+    """fallback: yf.download 5 วันก้อนเดียว — ได้ราคาล่าสุดกับราคาปิดก่อนหน้า (ไม่มี market cap)"""
+    out = {}
+    try:
+        data = yf.download(symbols, period='5d', interval='1d', progress=False, group_by='ticker',
+                           threads=True, timeout=20, auto_adjust=True)
+    except Exception as e:
+        logger.warning("quote_service yfinance fallback failed: %s", e)
+        return out
+    if data is None or data.empty:
+        return out
+    for sym in symbols:
+        try:
+            df = data[sym] if isinstance(data.columns, pd.MultiIndex) else data
+            closes = df['Close'].dropna()
+        except Exception:
+            continue
+        if closes.empty:
+            continue
+        out[sym] = {
+            'price': _to_float(closes.iloc[-1]),
+            'prev_close': _to_float(closes.iloc[-2]) if len(closes) >= 2 else None,
+            'market_cap': None,
+        }
+    return out
+
+
+def _store(quotes):
+    from .alert_engine import is_market_open
+
+    by_ttl = defaultdict(dict)
+    ttl_of_market = {}
+    for sym, q in quotes.items():
+        market = _market_of(sym)
+        if market not in ttl_of_market:
+            ttl_of_market[market] = _QUOTE_TTL_MARKET_OPEN if is_market_open(market) else _QUOTE_TTL_MARKET_CLOSED
+        by_ttl[ttl_of_market[market]][_QUOTE_CACHE_KEY.format(symbol=sym)] = q
+    for ttl, items in by_ttl.items():
+        cache.set_many(items, timeout=ttl)
+
+
+def _cached(symbols):
+    keys = {s: _QUOTE_CACHE_KEY.format(symbol=s) for s in symbols}
+    hit = cache.get_many(list(keys.values()))
+    return {s: hit[k] for s, k in keys.items() if k in hit}
+
+
+def get_quotes(symbols):
+    """
+    ราคาล่าสุดของหลาย symbol (รูปแบบ Yahoo) — อ่าน cache ก่อน ที่ขาดค่อยดึงจาก Yahoo แบบ batch
+    คืน {symbol: {'price', 'prev_close', 'market_cap'}} (symbol ที่หาราคาไม่ได้จะไม่อยู่ใน dict)
+    """
+    symbols = list(dict.fromkeys(s.strip().upper() for s in symbols if s))
+    if not symbols:
+        return {}
+
+    result = _cached(symbols)
+    missing = [s for s in symbols if s not in result]
+    if not missing:
+        return result
+
+    # จอง symbol ที่ยังไม่มีใครดึง / ที่เหลือรอคนที่กำลังดึงอยู่
+    mine, waiting = [], []
+    with _inflight_lock:
+        for s in missing:
+            ev = _inflight.get(s)
+            if ev is None:
+                _inflight[s] = threading.Event()
+                mine.append(s)
+            else:
+                waiting.append(ev)
+
+    try:
+        if mine:
+            fetched = _fetch_yq(mine)
+            rest = [s for s in mine if s not in fetched]
+            if rest:
+                fetched.update(_fetch_yf(rest))
+            if fetched:
+                _store(fetched)
+            result.update(fetched)
+    finally:
+        with _inflight_lock:
+            for s in mine:
+                _inflight.pop(s).set()
+
+    if waiting:
+        for ev in waiting:
+            ev.wait(timeout=_INFLIGHT_WAIT_SECONDS)
+        result.update(_cached([s for s in missing if s not in mine]))
+    return result
+
+
+def get_quote(symbol):
+    """ราคาล่าสุดของ symbol เดียว (dict เหมือน get_quotes หรือ None ถ้าหาไม่ได้)"""
+    return get_quotes([symbol]).get(symbol.strip().upper())
+
+
+def get_live_prices(symbols):
+    """{symbol: last price} — ทางลัดสำหรับจุดที่ใช้แค่ราคา"""
+    return {s: q['price'] for s, q in get_quotes(symbols).items() if q.get('price')}
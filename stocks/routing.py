@@ -0,0 +1,7 @@
+from django.urls import re_path
+from . import consumers
+
+# เส้นทางการเข้าถึง WebSocket สำหรับสถานะงานสแกนหุ้น (progress ของ scanner เบื้องหลัง)
+websocket_urlpatterns = [
+    re_path(r'ws/stocks/scan-status/$', consumers.ScanStatusConsumer.as_asgi()),
+]
@@ -0,0 +1,204 @@
+# ====== rs_engine.py — RS Rating แบบ cross-sectional ของทั้งตลาด คำนวณวันละครั้ง ======
+# เดิม scanner แต่ละตัวคำนวณ RS เอง: Precision / Momentum / Cup & Handle / Mean Reversion rank ผลตอบแทน 66 แท่ง
+# ภายใน universe ของตัวเอง ส่วน US Momentum / US SEPA ใช้สูตร IBD 4 ไตรมาส — คนที่กดสแกนหลายตัวติดกัน
+# จ่ายค่าคำนวณ RS ซ้ำทุกตัว และได้ RS ของหุ้นตัวเดียวกันไม่ตรงกันระหว่างหน้า
+#
+# โมดูลนี้:
+#   - compute_rs_table: ราคาปิด 253 แท่งท้ายของทุกหุ้นเรียงเป็น matrix เดียว (หุ้น × แท่ง, เติม NaN ด้านหน้า)
+#     แล้วได้ผลตอบแทน 1m/3m/6m/12m + คะแนน IBD + percentile ของทั้งตลาดในรอบเดียวแบบ vectorized
+#   - build_snapshot: ทุก ScannableSymbol ที่ active ของตลาด → ตาราง RelativeStrengthSnapshot
+#   - get_rs_ratings: อ่าน snapshot ล่าสุด (สร้างให้ก่อนถ้าวันนี้ยังไม่มี) → {symbol: rating}
+#     ใช้ fallback ranking แบบเดิมของ scanner เมื่อยังไม่มี snapshot (เช่น Yahoo ล่ม / ยังไม่มีรายชื่อหุ้น)
+#
+# รันหลังตลาดปิดให้ snapshot สดรอไว้ก่อนใครกดสแกน: python manage.py refresh_rs_snapshot
+
+import logging
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone as dj_timezone
+
+from .models import RelativeStrengthSnapshot, ScannableSymbol
+
+logger = logging.getLogger(__name__)
+
+# ผลตอบแทนย้อนหลังกี่แท่ง (iloc[-n]) ต่อช่วงเวลา — 3m = 66 แท่งเท่ากับที่ scanner เดิมใช้
+HORIZONS = {'1m': 22, '3m': 66, '6m': 127, '12m': 253}
+# IBD: ไตรมาสล่าสุด 40% + 3 ไตรมาสก่อนหน้า 20% — จุดแบ่งไตรมาสตามสูตรเดิมของ US Momentum / US SEPA
+_IBD_POINTS = (1, 64, 127, 190, 253)
+_IBD_WEIGHTS = (0.4, 0.2, 0.2, 0.2)
+_WINDOW = max(max(HORIZONS.values()), _IBD_POINTS[-1])
+
+# ดึงแท่งย้อนหลังกี่วัน (ปฏิทิน) — 253 แท่งทำการ + วันหยุดยาว
+_LOOKBACK_DAYS = 400
+# เก็บ snapshot ย้อนหลังกี่วัน (ปฏิทิน)
+_KEEP_DAYS = 90
+_LOCK_KEY = 'rs_snapshot_lock_{market}'
+_LOCK_TTL = 15 * 60
+
+
+def percentile_ratings(values):
+    """อันดับ percentile 0-99 (แบบ IBD / Minervini) — {symbol: ค่า} → {symbol: int} ข้ามค่า NaN"""
+    ser = pd.Series(values, dtype=float).dropna()
+    if ser.empty:
+        return {}
+    return (ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
+
+
+def _close_matrix(bars, symbols, key):
+    """ราคาปิด _WINDOW แท่งท้าย (ตัด NaN) ของแต่ละหุ้น เรียงเป็น matrix (หุ้น × แท่ง) เติม NaN ด้านหน้า"""
+    rows, found, last_dates = [], [], []
+    for symbol in symbols:
+        df = bars.get(key(symbol))
+        if df is None or df.empty:
+            continue
+        close = df['Close']
+        close = close[close.notna()]
+        if close.empty:
+            continue
+        tail = close.to_numpy(dtype=np.float64)[-_WINDOW:]
+        row = np.full(_WINDOW, np.nan)
+        row[_WINDOW - len(tail):] = tail
+        rows.append(row)
+        found.append(symbol)
+        last_dates.append(close.index[-1])
+    matrix = np.vstack(rows) if rows else np.empty((0, _WINDOW))
+    return found, matrix, last_dates
+
+
+def _returns(matrix, start, end=1):
+    """ผลตอบแทน (สัดส่วน) จาก iloc[-start] ถึง iloc[-end] ของทุกแถว (ประวัติไม่ถึง → NaN)"""
+    base = matrix[:, _WINDOW - start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (matrix[:, _WINDOW - end] - base) / np.abs(base)
+
+
+def compute_rs_table(bars, symbols, key=None):
+    """
+    RS ของทุก symbol ในรอบเดียว
+    bars: {key: DataFrame OHLCV} จาก bar_store.get_bars / key: symbol → key ใน bars (ไม่ใส่ = symbol ตรงๆ)
+    Returns: DataFrame index = symbol, คอลัมน์ ret_1m / ret_3m / ret_6m / ret_12m / rs_score /
+             rs_rating / rs_3m_rating / date (วันที่ของแท่งล่าสุดของหุ้นตัวนั้น)
+    """
+    key = key or (lambda s: s)
+    found, matrix, last_dates = _close_matrix(bars, symbols, key)
+    table = pd.DataFrame(index=pd.Index(found, name='symbol'))
+    if not found:
+        return table
+
+    for name, n in HORIZONS.items():
+        table[f'ret_{name}'] = _returns(matrix, n) * 100
+    # คะแนน IBD: ต้องมีประวัติครบ 4 ไตรมาส (NaN ไตรมาสไหนก็ NaN ทั้งแถว)
+    score = np.zeros(len(found))
+    for weight, (end, start) in zip(_IBD_WEIGHTS, zip(_IBD_POINTS, _IBD_POINTS[1:])):
+        score = score + _returns(matrix, start, end) * weight
+    table['rs_score'] = score * 100
+
+    # ประวัติไม่พอ → rating เป็น <NA> ไม่ใช่ 0 (ผู้ใช้ต้อง fallback ไปสูตรอื่นเองได้ เช่น Trend Template ของหุ้นเข้าใหม่)
+    table['rs_rating'] = pd.Series(percentile_ratings(table['rs_score'])).reindex(table.index).astype('Int64')
+    table['rs_3m_rating'] = pd.Series(percentile_ratings(table['ret_3m'])).reindex(table.index).astype('Int64')
+    table['date'] = [pd.Timestamp(d).date() for d in last_dates]
+    return table
+
+
+def _nullable(value):
+    return None if value is None or np.isnan(value) else round(float(value), 4)
+
+
+def _nullable_rating(value):
+    return None if pd.isna(value) else int(value)
+
+
+def build_snapshot(market):
+    """
+    คำนวณ RS ของทุก ScannableSymbol ที่ active ในตลาด แล้วเขียนทับ snapshot ของวันทำการล่าสุด
+    Returns: วันที่ของ snapshot (None ถ้าไม่มีข้อมูลราคาเลย)
+    """
+    from .bar_store import get_bars
+    from .scan_pipeline import MARKETS
+
+    spec = MARKETS.get(market)
+    yahoo = spec.yahoo if spec else (lambda s: s)
+    symbols = list(
+        ScannableSymbol.objects.filter(market=market, is_active=True).values_list('symbol', flat=True)
+    )
+    if not symbols:
+        return None
+
+    today = dj_timezone.localdate()
+    bars = get_bars([yahoo(s) for s in symbols], today - timedelta(days=_LOOKBACK_DAYS), today + timedelta(days=1))
+    table = compute_rs_table(bars, symbols, key=yahoo)
+    if table.empty:
+        return None
+
+    # วันทำการของ snapshot = แท่งล่าสุดของตลาด (หุ้นที่ถูกพักการซื้อขายอาจมีแท่งสุดท้ายเก่ากว่า)
+    as_of = max(table['date'])
+    rows = [
+        RelativeStrengthSnapshot(
+            market=market, symbol=symbol, date=as_of,
+            ret_1m=_nullable(r.ret_1m), ret_3m=_nullable(r.ret_3m),
+            ret_6m=_nullable(r.ret_6m), ret_12m=_nullable(r.ret_12m),
+            rs_score=_nullable(r.rs_score), rs_rating=_nullable_rating(r.rs_rating), rs_3m_rating=_nullable_rating(r.rs_3m_rating),
+        )
+        for symbol, r in zip(table.index, table.itertuples(index=False))
+    ]
+    with transaction.atomic():
+        RelativeStrengthSnapshot.objects.filter(market=market, date=as_of).delete()
+        RelativeStrengthSnapshot.objects.bulk_create(rows, batch_size=1000)
+        RelativeStrengthSnapshot.objects.filter(
+            market=market, date__lt=as_of - timedelta(days=_KEEP_DAYS)).delete()
+    logger.info("[RSEngine] %s snapshot %s: %d symbols", market, as_of, len(rows))
+    return as_of
+
+
+def latest_snapshot_date(market):
+    return (
+        RelativeStrengthSnapshot.objects.filter(market=market)
+        .order_by('-date').values_list('date', flat=True).first()
+    )
+
+
+def ensure_snapshot(market):
+    """
+    วันที่ของ snapshot ที่ใช้ได้ — ถ้ายังไม่มี snapshot ที่คำนวณในวันนี้ให้คำนวณก่อน (ครั้งเดียวต่อวัน)
+    มีงานอื่นกำลังคำนวณอยู่ → ใช้ snapshot ล่าสุดที่มีไปก่อน ไม่รอ
+    """
+    latest = (
+        RelativeStrengthSnapshot.objects.filter(market=market)
+        .order_by('-computed_at').values_list('date', 'computed_at').first()
+    )
+    if latest and dj_timezone.localtime(latest[1]).date() == dj_timezone.localdate():
+        return latest[0]
+    lock_key = _LOCK_KEY.format(market=market)
+    if not cache.add(lock_key, 1, _LOCK_TTL):
+        return latest[0] if latest else None
+    try:
+        return build_snapshot(market) or (latest[0] if latest else None)
+    except Exception as e:
+        logger.warning("[RSEngine] %s snapshot failed: %s", market, e)
+        return latest[0] if latest else None
+    finally:
+        cache.delete(lock_key)
+
+
+def get_rs_ratings(market, field='rs_rating', fallback=None):
+    """
+    RS ของทุกหุ้นในตลาดจาก snapshot ล่าสุด → {symbol: 0-99}
+    หุ้นที่ประวัติไม่พอ (rating เป็น NULL) จะไม่อยู่ใน dict — ผู้เรียกใช้ .get(symbol, ค่าสำรอง) ได้
+    field: 'rs_rating' (IBD 4 ไตรมาส) หรือ 'rs_3m_rating' (ผลตอบแทน 66 แท่ง)
+    fallback: {symbol: ผลตอบแทนดิบ} ของ scanner — ใช้ rank แทนเมื่อยังไม่มี snapshot
+    """
+    as_of = ensure_snapshot(market)
+    ratings = {}
+    if as_of:
+        ratings = dict(
+            RelativeStrengthSnapshot.objects.filter(market=market, date=as_of, **{f'{field}__isnull': False})
+            .values_list('symbol', field)
+        )
+    if not ratings and fallback:
+        logger.warning("[RSEngine] %s snapshot unavailable — ranking %d symbols locally", market, len(fallback))
+        ratings = percentile_ratings(fallback)
+    return ratings
@@ -0,0 +1,1196 @@
+# ====== scan_evaluators.py — ขั้นประเมินเชิงลึกต่อหุ้น (CPU ล้วน) ของ scanner ======
+# ฟังก์ชันในไฟล์นี้ต้องเป็นระดับโมดูลและรับ input ที่ pickle ได้ทั้งหมด (symbol, DataFrame, ctx dict)
+# เพราะ stocks.scan_executor ส่งไปรันใน process pool แยกจาก web process
+# — ห้ามอ่าน/เขียน DB, cache หรือสถานะสแกนจากในนี้ (ทำที่ฝั่งผู้เรียกหลังได้ผลกลับมา)
+
+import pandas as pd
+import pandas_ta as ta
+
+from .utils import (
+    analyze_momentum_technical_v2,
+    detect_cup_and_handle,
+    detect_price_pattern,
+    detect_vcp_pattern,
+    find_supply_demand_zones,
+    find_supply_demand_zones_v2,
+)
+
+
+def evaluate_precision_symbol(symbol, df, ctx):
+    """
+    Precision Momentum — Phase 2 (Deep Scan) ของหุ้น 1 ตัว ใช้ร่วมกันทั้ง SET และ US
+    ctx: {'rs_ratings': {symbol: RS 0-99}, 'index_1m_return': %, 'index_3m_return': %,
+          'trend_rs_ratings': {symbol: RS แบบ IBD 0-99} (ไม่มี → ใช้ rs_ratings)}
+         (index = ^SET.BK สำหรับ SET, SPY สำหรับ US)
+    Returns: dict ผลของหุ้นที่ผ่านเกณฑ์ (ยังไม่มี fundamental) หรือ None
+    """
+    rs_ratings = ctx.get('rs_ratings') or {}
+    trend_rs_ratings = ctx.get('trend_rs_ratings') or {}
+    index_1m_return = ctx.get('index_1m_return', 0.0)
+    index_3m_return = ctx.get('index_3m_return', 0.0)
+
+    try:
+        if df is None or df.empty:
+            return None
+
+        df = df.dropna(subset=['Close', 'High'])
+        if len(df) < 200:
+            return None
+
+        # ====== Liquidity & Quality Filters (Institutional Grade) ======
+        avg_vol_20 = float(df['Volume'].tail(20).mean())
+        avg_close_20 = float(df['Close'].tail(20).mean())
+        avg_turnover_20 = avg_vol_20 * avg_close_20
+
+        import logging as _lg; _scan_log = _lg.getLogger('stocks.scan')
+        current_price = float(df['Close'].iloc[-1])
+
+        # 1. Turnover >= 10M THB
+        if avg_turnover_20 < 10_000_000:
+            _scan_log.info(f"[SCAN SKIP] {symbol}: Turnover ฿{avg_turnover_20/1e6:.1f}M < 10M")
+            return None
+
+        # 2. Minimum Price >= 1.00
+        if current_price < 1.00:
+            _scan_log.info(f"[SCAN SKIP] {symbol}: Price ฿{current_price} < 1.00")
+            return None
+
+        # ====== Early Accumulation (Pre-Breakout Volume Surge & Tightness) ======
+        # เช็คว่ามี Volume พุ่งสูง หรือ ราคากำลังบีบตัว (VCP) หรือ ปริมาณการซื้อขายแห้ง (VDU)
+        early_accumulation = False
+        try:
+            if len(df) >= 20:
+                # 1. Check Volume Surge (2.5x)
+                for i in range(-5, 0):
+                    vol_i = float(df['Volume'].iloc[i])
+                    close_i = float(df['Close'].iloc[i])
+                    open_i = float(df['Open'].iloc[i])
+                    if close_i > open_i and vol_i >= (avg_vol_20 * 2.5):
+                        early_accumulation = True
+                        break
+
+                # 2. Check Price Tightness (SD < 2.5%) -> VCP / Coiling
+                if not early_accumulation:
+                    std_5 = float(df['Close'].tail(5).std())
+                    tightness = (std_5 / current_price * 100) if current_price > 0 else 99
+                    if tightness <= 2.5:
+                        early_accumulation = True
+
+                # 3. Check Volume Dry Up (VDU) -> แรงขายหมด
+                if not early_accumulation:
+                    vol_3d_avg = float(df['Volume'].tail(3).mean())
+                    if vol_3d_avg < avg_vol_20 * 0.5:
+                        early_accumulation = True
+        except Exception:
+            pass
+
+        # 3. RS Rating >= 60 (อนุโลมถ้ามี Early Accumulation)
+        rs_val = rs_ratings.get(symbol, None)
+        if rs_val is not None and rs_val < 60 and not early_accumulation:
+            _scan_log.info(f"[SCAN SKIP] {symbol}: RS {rs_val} < 60")
+            return None
+
+        # ====== คำนวณ Indicators ======
+        df['EMA200'] = ta.ema(df['Close'], length=200)
+        df['EMA50'] = ta.ema(df['Close'], length=50)
+        df['RSI'] = ta.rsi(df['Close'], length=14)
+        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
+        if adx_df is not None and not adx_df.empty:
+            df = pd.concat([df, adx_df], axis=1)
+        mfi_series = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
+        df['MFI'] = mfi_series
+
+        last_row = df.iloc[-1]
+        current_price = float(last_row['Close'])
+        ema200 = float(df['EMA200'].iloc[-1]) if pd.notna(df['EMA200'].iloc[-1]) else current_price
+        year_high = float(df['High'].tail(252).max())
+
+        # ====== ADX Filter ======
+        adx_val = float(df['ADX_14'].iloc[-1]) if 'ADX_14' in df.columns and pd.notna(df['ADX_14'].iloc[-1]) else 0
+        if adx_val < 15 and not early_accumulation:
+            _scan_log.info(f"[SCAN SKIP] {symbol}: ADX {adx_val:.1f} < 15")
+            return None
+
+        # ====== Trend Template Filter ======
+        near_high  = current_price >= year_high * 0.65
+        if not near_high and not early_accumulation:
+            _scan_log.info(f"[SCAN SKIP] {symbol}: Price ฿{current_price} < 65% of 52wH ฿{year_high} ({current_price/year_high*100:.0f}%)")
+            return None
+
+        import logging; logger = logging.getLogger('stocks')
+        logger.debug(f"[Precision] MATCH: {symbol} (ADX:{adx_val:.1f})")
+
+        # ====== Precision Technical Analysis (v3) ======
+        tech = analyze_momentum_technical_v2(df)
+        integrated_score = tech['score']
+        rvol         = tech['rvol']
+        rsi          = tech['rsi']
+        rvol_bullish = tech['rvol_bullish']
+        sd_zone      = tech['sd_zone']
+        ema20_aligned_flag = tech.get('ema20_aligned', False)
+        ema20_slope_val    = tech.get('ema20_slope', 0.0)
+        ema20_rising_flag  = tech.get('ema20_rising', False)
+        hh_hl_flag         = tech.get('hh_hl_structure', False)
+
+        mfi_val = float(df['MFI'].iloc[-1]) if 'MFI' in df.columns and pd.notna(df['MFI'].iloc[-1]) else 0
+
+        # ====== MACD (12,26,9) - histogram + bullish crossover detection ======
+        macd_hist_val  = None
+        macd_cross_val = False
+        try:
+            macd_df = ta.macd(df['Close'], fast=12, slow=26, signal=9)
+            if macd_df is not None and not macd_df.empty:
+                hist_col = [c for c in macd_df.columns if 'h' in c.lower() or 'hist' in c.lower()]
+                macd_col = [c for c in macd_df.columns if c.lower().startswith('macd_')]
+                sig_col  = [c for c in macd_df.columns if 'macds' in c.lower() or 'signal' in c.lower()]
+                if hist_col:
+                    macd_hist_val = float(macd_df[hist_col[0]].iloc[-1]) if pd.notna(macd_df[hist_col[0]].iloc[-1]) else None
+                # Bullish crossover = MACD line crosses above signal line in last 3 bars
+                if macd_col and sig_col:
+                    m_ser = macd_df[macd_col[0]].dropna()
+                    s_ser = macd_df[sig_col[0]].dropna()
+                    if len(m_ser) >= 4 and len(s_ser) >= 4:
+                        # Check if MACD crossed above signal in last 3 candles
+                        for i in range(-3, 0):
+                            if m_ser.iloc[i-1] <= s_ser.iloc[i-1] and m_ser.iloc[i] > s_ser.iloc[i]:
+                                macd_cross_val = True
+                                break
+        except Exception:
+            pass
+
+        # ====== Bollinger Bands Squeeze - bandwidth in bottom 20th pct (pending breakout) ======
+        bb_squeeze_flag = False
+        try:
+            bb_df = ta.bbands(df['Close'], length=20, std=2)
+            if bb_df is not None and not bb_df.empty:
+                upper_col = [c for c in bb_df.columns if 'BBU' in c or 'upper' in c.lower()]
+                lower_col = [c for c in bb_df.columns if 'BBL' in c or 'lower' in c.lower()]
+                mid_col   = [c for c in bb_df.columns if 'BBM' in c or 'mid' in c.lower()]
+                if upper_col and lower_col and mid_col:
+                    bbu = bb_df[upper_col[0]].dropna()
+                    bbl = bb_df[lower_col[0]].dropna()
+                    bbm = bb_df[mid_col[0]].dropna()
+                    if len(bbu) >= 20:
+                        bw = (bbu - bbl) / bbm  # bandwidth ratio
+                        pct20 = bw.quantile(0.20)
+                        if float(bw.iloc[-1]) <= float(pct20):
+                            bb_squeeze_flag = True
+        except Exception:
+            pass
+
+        # ====== Stage 2 (Weinstein): price > SMA150 AND SMA150 rising ======
+        # Stage 2 = markup phase - หุ้นที่ผ่าน filter นี้อยู่ในช่วงที่ดีที่สุดสำหรับการซื้อ
+        stage2_flag = False
+        try:
+            sma150 = ta.sma(df['Close'], length=150)
+            if sma150 is not None:
+                sma150_clean = sma150.dropna()
+                if len(sma150_clean) >= 20:
+                    sma150_cur = float(sma150_clean.iloc[-1])
+                    sma150_4w  = float(sma150_clean.iloc[-20])  # ~4 สัปดาห์ก่อน
+                    stage2_flag = (current_price > sma150_cur) and (sma150_cur > sma150_4w)
+        except Exception:
+            pass
+
+        # ====== Fundamental Data (bulk-fetched after all threads complete) ======
+        # ตัวแปรเหล่านี้ไม่ถูกใช้ใน thread - bulk enrichment เป็นตัวทำใน step 2
+
+        # ====== Supply & Demand Zone ======
+        entry_strat = ""
+        dz_start = None
+        dz_end = None
+        sz_start = None
+        sz_end = None
+        sl_price = None
+        rr_val = None
+        erc_vol_confirmed = False
+        zone_target_src = '52w'
+
+        if sd_zone:
+            entry_strat = sd_zone['type']
+            dz_start = sd_zone['start']
+            dz_end = sd_zone['end']
+            sz_start = sd_zone['target']
+            sz_end = sd_zone['target'] * 1.02
+            sl_price = sd_zone['stop_loss']
+            rr_val = sd_zone['rr_ratio']
+            erc_vol_confirmed = sd_zone.get('erc_volume_confirmed', False)
+            zone_target_src = sd_zone.get('zone_target_source', '52w')
+
+        prox_val = 999.0
+        if dz_start:
+            if current_price <= dz_start:
+                prox_val = 0.0
+            else:
+                prox_val = ((current_price - dz_start) / dz_start) * 100
+
+        gap_to_high = ((year_high - current_price) / current_price) * 100
+
+        # ====== Pocket Pivot (Morales & Kacher) ======
+        # Up-day volume > highest down-day volume in prior 10 sessions
+        # ====== Moving averages for Kacher/Morales exit rule (SMA10/SMA50) ======
+        ma10_val = ma50_val = 0.0
+        try:
+            _sma10 = ta.sma(df['Close'], length=10)
+            _sma50 = ta.sma(df['Close'], length=50)
+            if _sma10 is not None and pd.notna(_sma10.iloc[-1]): ma10_val = float(_sma10.iloc[-1])
+            if _sma50 is not None and pd.notna(_sma50.iloc[-1]): ma50_val = float(_sma50.iloc[-1])
+        except Exception:
+            pass
+
+        pocket_pivot_flag = False
+        pp_at_ma50_flag = False   # PP แท้ตามตำรา Dr.K: เด้งจากแนวรับ SMA50 ในฐาน
+        try:
+            if len(df) >= 14:
+                closes = df['Close'].values
+                volumes = df['Volume'].values
+                for _i in [-1, -2]:
+                    if float(closes[_i]) <= float(closes[_i - 1]):
+                        continue  # not an up day
+                    _start = len(volumes) + _i - 10
+                    _end   = len(volumes) + _i
+                    if _start < 1:
+                        continue
+                    _prior_c = closes[_start:_end]
+                    _prior_v = volumes[_start:_end]
+                    _prior_prev_c = closes[_start - 1:_end - 1]
+                    _down_mask = _prior_c < _prior_prev_c
+                    if not _down_mask.any():
+                        continue
+                    _max_down_vol = float(_prior_v[_down_mask].max())
+                    if float(volumes[_i]) > _max_down_vol and _max_down_vol > 0:
+                        pocket_pivot_flag = True
+                        # PP-at-MA50 (⭐): ต้องครบ 3 เงื่อนไข —
+                        #   1) ราคายืนเหนือ SMA50 ไม่เกิน 8% (เด้งจากแนวรับในฐาน)
+                        #   2) CMF ≥ 0 (เงินสถาบันไม่ได้กำลังกระจายของ)
+                        # ป้องกันดาวหลอกกรณีเด้ง 1 วันในเฟส distribution
+                        _pp_cmf = tech.get('cmf', 0.0) or 0.0
+                        if ma50_val > 0 and _pp_cmf >= 0:
+                            _pp_close = float(closes[_i])
+                            if _pp_close >= ma50_val and (_pp_close - ma50_val) / ma50_val <= 0.08:
+                                pp_at_ma50_flag = True
+                        break
+        except Exception:
+            pass
+
+        # Wyckoff Spring + Upthrust + Effort-vs-Result divergence + Selling Climax (Phase A)
+        wyckoff_spring_flag = False
+        wyckoff_upthrust_flag = False
+        wyckoff_er_warning_flag = False
+        wyckoff_selling_climax_flag = False
+        try:
+            from stocks.utils import (
+                detect_effort_result_divergence,
+                detect_selling_climax,
+                detect_wyckoff_spring,
+                detect_wyckoff_upthrust,
+            )
+            wyckoff_spring_flag, _ = detect_wyckoff_spring(df)
+            wyckoff_upthrust_flag, _ = detect_wyckoff_upthrust(df)
+            wyckoff_er_warning_flag, _ = detect_effort_result_divergence(df)
+            wyckoff_selling_climax_flag, _ = detect_selling_climax(df)
+        except Exception:
+            pass
+
+        # Minervini Trend Template (8 ข้อเต็ม) + Cheat Entry
+        tt_score_val = 0
+        tt_passed_flag = False
+        cheat_entry_flag = False
+        try:
+            from stocks.utils import check_trend_template, detect_cheat_entry
+            # Trend Template ข้อ RS >= 70 หมายถึง RS Rating แบบ IBD (4 ไตรมาส) จาก RelativeStrengthSnapshot
+            _tt = check_trend_template(df, trend_rs_ratings.get(symbol, rs_ratings.get(symbol, 0)))
+            tt_score_val = _tt.get('score', 0)
+            tt_passed_flag = _tt.get('passed', False)
+            cheat_entry_flag = detect_cheat_entry(df)
+        except Exception:
+            pass
+
+        # ====== Volume Dry-Up (VDU): เงียบสะสม - volume ลด 3 วันติด + ต่ำกว่า median 70% (ป้องกัน volume spike) ======
+        vdu_flag = False
+        try:
+            if len(df) >= 4:
+                _vols = df['Volume'].tail(4).values.astype(float)
+                _median20 = float(df['Volume'].tail(20).median())
+                _declining = (_vols[-1] < _vols[-2]) and (_vols[-2] < _vols[-3])
+                _quiet     = _vols[-1] < _median20 * 0.7
+                vdu_flag   = _declining and _quiet
+        except Exception:
+            pass
+
+        # ====== Ichimoku Cloud ======
+        ichimoku_above_kumo = False
+        ichimoku_tk_cross   = False
+        ichimoku_kumo_green = False
+        ichimoku_chikou_ok  = False
+        ichimoku_score_val  = 0
+        try:
+            if len(df) >= 52:
+                _h9  = df['High'].rolling(9).max()
+                _l9  = df['Low'].rolling(9).min()
+                _h26 = df['High'].rolling(26).max()
+                _l26 = df['Low'].rolling(26).min()
+                _h52 = df['High'].rolling(52).max()
+                _l52 = df['Low'].rolling(52).min()
+                _tenkan = (_h9  + _l9)  / 2
+                _kijun  = (_h26 + _l26) / 2
+                _span_a = ((_tenkan + _kijun) / 2).shift(26)
+                _span_b = ((_h52   + _l52)  / 2).shift(26)
+                _sa_cur = float(_span_a.iloc[-1]) if pd.notna(_span_a.iloc[-1]) else 0
+                _sb_cur = float(_span_b.iloc[-1]) if pd.notna(_span_b.iloc[-1]) else 0
+                # 1) Price above Kumo
+                ichimoku_above_kumo = current_price > max(_sa_cur, _sb_cur) > 0
+                # 2) TK Cross bullish in last 5 bars
+                for _i in range(-5, 0):
+                    if (_tenkan.iloc[_i-1] <= _kijun.iloc[_i-1]
+                            and _tenkan.iloc[_i] > _kijun.iloc[_i]):
+                        ichimoku_tk_cross = True
+                        break
+                # 3) Future Kumo green (SpanA > SpanB at current shifted position)
+                ichimoku_kumo_green = _sa_cur > _sb_cur and _sa_cur > 0
+                # 4) Chikou Span clear (current close > close 26 bars ago)
+                if len(df) >= 27:
+                    ichimoku_chikou_ok = float(df['Close'].iloc[-1]) > float(df['Close'].iloc[-27])
+                ichimoku_score_val = sum([ichimoku_above_kumo, ichimoku_tk_cross,
+                                         ichimoku_kumo_green, ichimoku_chikou_ok])
+        except Exception:
+            pass
+
+        # Price Pattern detection (ใช้ df ที่มีอยู่แล้ว)
+        pattern_result = detect_price_pattern(df)
+        pattern_name  = pattern_result['name']
+        pattern_score = pattern_result['score']
+
+        close_series = df['Close'].dropna()
+        rel_1m = rel_3m = 0.0
+        stock_3m_ret = 0.0
+        if len(close_series) >= 66:
+            stock_1m = float((close_series.iloc[-1] - close_series.iloc[-22]) / close_series.iloc[-22] * 100)
+            stock_3m = float((close_series.iloc[-1] - close_series.iloc[-66]) / close_series.iloc[-66] * 100)
+            stock_3m_ret = stock_3m
+            rel_1m = round(stock_1m - index_1m_return, 2)
+            rel_3m = round(stock_3m - index_3m_return, 2)
+        elif len(close_series) >= 22:
+            stock_1m = float((close_series.iloc[-1] - close_series.iloc[-22]) / close_series.iloc[-22] * 100)
+            rel_1m = round(stock_1m - index_1m_return, 2)
+
+
+
+        # ====== Advanced Precision Bonus/Penalty ======
+        from stocks.utils import detect_vcp_pattern
+        vcp = detect_vcp_pattern(df)
+        vcp_setup_flag = vcp.get('setup', False)
+        vcp_tightness_val = vcp.get('tightness', 999.0)
+
+        inside_bar_flag = False
+        if len(df) >= 2:
+            c0 = df.iloc[-1]
+            c1 = df.iloc[-2]
+            inside_bar_flag = c0['High'] <= c1['High'] and c0['Low'] >= c1['Low']
+
+        if vcp_setup_flag:
+            integrated_score += 10
+            if vcp_tightness_val <= 10:
+                integrated_score += 5
+
+        # Pocket Pivot
+        if pp_at_ma50_flag:
+            integrated_score += 15
+        elif pocket_pivot_flag:
+            integrated_score += 5
+
+        # Turtle Breakout (จ่อเบรค)
+        turtle_dist = tech.get('turtle_dist_pct', 99.0)
+        if turtle_dist <= 2.0:
+            integrated_score += 10
+
+        # Wyckoff Dynamics
+        if wyckoff_spring_flag:
+            integrated_score += 10
+        if wyckoff_upthrust_flag:
+            integrated_score -= 20
+        if wyckoff_er_warning_flag:
+            _is_bear = (not rvol_bullish) or (tech.get('dist_days', 0) >= 3) or (tech.get('cmf', 0) < -0.1)
+            if _is_bear:
+                integrated_score -= 15
+            else:
+                integrated_score += 10
+        if wyckoff_selling_climax_flag:
+            integrated_score += 5
+
+        # Inside Bar
+        if inside_bar_flag:
+            integrated_score += 5
+
+        integrated_score = min(max(integrated_score, 0), 100)
+        # Return dict instead of model to allow bulk fundamental enrichment and RS Ranking
+        return {
+            'symbol': symbol,
+            'price': round(current_price, 2),
+            'rsi': round(rsi, 2),
+            'adx': round(adx_val, 2),
+            'mfi': round(mfi_val, 2),
+            'rvol': round(rvol, 2),
+            'technical_score': int(integrated_score),
+            'avg_volume_20d': round(avg_vol_20, 0),
+            'rvol_bullish': rvol_bullish,
+            'erc_volume_confirmed': erc_vol_confirmed,
+            'zone_target_src': zone_target_src,
+            'entry_strat': entry_strat,
+            'dz_start': dz_start,
+            'dz_end': dz_end,
+            'sz_start': sz_start,
+            'sz_end': sz_end,
+            'sl_price': sl_price,
+            'rr_val': rr_val,
+            'year_high': round(year_high, 2),
+            'upside_to_high': round(gap_to_high, 2),
+            'prox_val': round(prox_val, 2),
+            'pattern_name': pattern_name,
+            'pattern_score': pattern_score,
+            'rel_1m': rel_1m,
+            'rel_3m': rel_3m,
+            'macd_histogram': round(macd_hist_val, 4) if macd_hist_val is not None else None,
+            'macd_crossover': macd_cross_val,
+            'bb_squeeze': bb_squeeze_flag,
+            'ema20_aligned': ema20_aligned_flag,
+            'ema20_slope': round(ema20_slope_val, 3),
+            'ema20_rising': ema20_rising_flag,
+            'hh_hl_structure': hh_hl_flag,
+            'stock_3m_ret': stock_3m_ret,
+            'rs_rating': rs_ratings.get(symbol, 0),
+            'stage2': stage2_flag,
+            'pocket_pivot': pocket_pivot_flag,
+            'pp_at_ma50': pp_at_ma50_flag,
+            'wyckoff_spring': wyckoff_spring_flag,
+            'wyckoff_upthrust': wyckoff_upthrust_flag,
+            'wyckoff_effort_result_warning': wyckoff_er_warning_flag,
+            'wyckoff_selling_climax': wyckoff_selling_climax_flag,
+            'trend_template_score': tt_score_val,
+            'trend_template_passed': tt_passed_flag,
+            'cheat_entry': cheat_entry_flag,
+            'ma10': round(ma10_val, 2),
+            'ma50': round(ma50_val, 2),
+            'vdu_near_zone': vdu_flag,
+            'cmf': tech.get('cmf', 0.0),
+            'is_52w_breakout': tech.get('is_52w_breakout', False),
+            'volume_surge': tech.get('volume_surge', 1.0),
+            'is_volume_surge': tech.get('is_volume_surge', False),
+            'ichimoku_above_kumo': ichimoku_above_kumo,
+            'ichimoku_tk_cross': ichimoku_tk_cross,
+            'ichimoku_kumo_green': ichimoku_kumo_green,
+            'ichimoku_chikou_ok': ichimoku_chikou_ok,
+            'ichimoku_score': ichimoku_score_val,
+            # ====== VCP Detection ======
+            'vcp': vcp,
+            # ====== Launcher Data (v10) ======
+            'launcher_score': tech.get('launcher_score', 0),
+            'turtle_dist_pct': tech.get('turtle_dist_pct', 99.0),
+            'is_explosive': tech.get('is_explosive', False),
+            'tightness_idx': tech.get('tightness_idx', 99.0),
+            # ====== Pre-Breakout Signals (v13) ======
+            'inside_bar': tech.get('inside_bar', False),
+            'acc_days': tech.get('acc_days', 0),
+            'dist_days': tech.get('dist_days', 0),
+
+            # ====== John Ehlers Indicators (v12) ======
+            'ehlers_supersmoother': tech.get('ehlers_supersmoother', current_price),
+            'ehlers_laguerre_rsi': tech.get('ehlers_laguerre_rsi', 0.5),
+            'ehlers_fisher': tech.get('ehlers_fisher', 0.0),
+            'ehlers_fisher_trigger': tech.get('ehlers_fisher_trigger', 0.0),
+            'ehlers_itl_daily': tech.get('ehlers_itl_daily', current_price),
+            'ehlers_itl_weekly': tech.get('ehlers_itl_weekly', current_price),
+            'ehlers_itl_bullish': tech.get('ehlers_itl_bullish', False),
+            'vp_poc_price': tech.get('vp_poc_price', None),
+            'vp_status': tech.get('vp_status') or '',
+            'vp_vah': tech.get('vp_vah'),
+            'vp_val': tech.get('vp_val'),
+            'vp_hvn': tech.get('vp_hvn') or [],
+            'vp_lvn': tech.get('vp_lvn') or [],
+            'vp_profiles': tech.get('vp_profiles') or {},
+        }
+
+    except Exception as e:
+        import logging
+        logging.getLogger('stocks').exception(f"[Precision] Error scanning {symbol}: {e}")
+        return None
+
+
+# ============================================================
+# ฟังก์ชัน: _mr_detect_pattern
+# วัตถุประสงค์: ตรวจจับรูปแบบแท่งเทียนกลับตัวขาขึ้น (Bullish Reversal Patterns)
+#   เช่น Hammer, Pin Bar, Bullish Engulf, Morning Star
+#   ใช้ข้อมูล OHLC 2-3 แท่งล่าสุดในการวิเคราะห์
+# ============================================================
+def _mr_detect_pattern(df):
+    """Detect bullish reversal patterns for MR Scanner."""
+    if len(df) < 3:
+        return ''
+    try:
+        o1, h1, l1, c1 = float(df['Open'].iloc[-2]), float(df['High'].iloc[-2]), float(df['Low'].iloc[-2]), float(df['Close'].iloc[-2])
+        o0, h0, l0, c0 = float(df['Open'].iloc[-1]), float(df['High'].iloc[-1]), float(df['Low'].iloc[-1]), float(df['Close'].iloc[-1])
+        body0   = abs(c0 - o0)
+        range0  = h0 - l0
+        if range0 == 0:
+            return ''
+        upper0 = h0 - max(c0, o0)
+        lower0 = min(c0, o0) - l0
+        # Hammer
+        if lower0 >= 2 * max(body0, 0.0001) and lower0 >= 2 * max(upper0, 0.0001) and c0 >= l0 + range0 * 0.5:
+            return 'Hammer'
+        # Pin Bar
+        if lower0 >= 2.5 * max(upper0, 0.0001) and body0 < range0 * 0.35:
+            return 'Pin Bar'
+        # Bullish Engulf
+        body1 = abs(c1 - o1)
+        if c1 < o1 and c0 > o0 and c0 > o1 and o0 <= c1 and body0 > body1 * 0.9:
+            return 'Bullish Engulf'
+        # Morning Star
+        if len(df) >= 3:
+            o2, c2 = float(df['Open'].iloc[-3]), float(df['Close'].iloc[-3])
+            body2 = abs(c2 - o2)
+            if c2 < o2 and body1 < max(body2, 0.0001) * 0.5 and c0 > o0 and c0 > (o2 + c2) / 2:
+                return 'Morning Star'
+    except Exception:
+        pass
+    return ''
+
+
+# ============================================================
+# ฟังก์ชัน: _mr_swing_support
+# วัตถุประสงค์: หาแนวรับ (Swing Low) ที่ใกล้ที่สุดต่ำกว่าราคาปัจจุบัน
+#   ใช้ lookback bar ย้อนหลังเพื่อหาจุดต่ำสุดเฉพาะที่ในกราฟ
+# ============================================================
+def _mr_swing_support(df, lookback=60):
+    """Nearest swing low below current price."""
+    try:
+        curr  = float(df['Close'].iloc[-1])
+        lows  = df['Low'].tail(lookback).values
+        swing = [lows[i] for i in range(2, len(lows) - 2) if lows[i] == min(lows[i-2:i+3])]
+        below = [s for s in swing if s < curr]
+        return max(below) if below else None
+    except Exception:
+        return None
+
+
+# ============================================================
+# ฟังก์ชัน: _mr_swing_resistance
+# วัตถุประสงค์: หาแนวต้าน (Swing High) ที่ใกล้ที่สุดสูงกว่าราคาปัจจุบัน
+#   ใช้ lookback bar ย้อนหลังเพื่อหาจุดสูงสุดเฉพาะที่ในกราฟ
+# ============================================================
+def _mr_swing_resistance(df, lookback=60):
+    """Nearest swing high above current price."""
+    try:
+        curr   = float(df['Close'].iloc[-1])
+        highs  = df['High'].tail(lookback).values
+        swing  = [highs[i] for i in range(2, len(highs) - 2) if highs[i] == max(highs[i-2:i+3])]
+        above  = [s for s in swing if s > curr]
+        return min(above) if above else None
+    except Exception:
+        return None
+
+
+# ============================================================
+# ฟังก์ชัน: _mr_r_score
+# วัตถุประสงค์: คำนวณ Mean Reversion Score (0-100)
+#   รวมปัจจัย: ADX (ความแข็งแกร่งของเทรนด์), RSI (Overbought/Oversold),
+#   Relative Volume (ปริมาณการซื้อขายสัมพัทธ์), รูปแบบแท่งเทียน,
+#   และระยะห่างจากแนวรับ — คะแนนสูง = โอกาสกลับตัวสูง
+# ============================================================
+def _mr_r_score(rsi, adx, rvol, pattern, direction, dist_support_pct):
+    score = 50
+    if adx < 15:   score += 15
+    elif adx < 20: score += 10
+    elif adx < 25: score += 5
+    if direction == 'oversold':
+        if rsi < 25:   score += 20
+        elif rsi < 30: score += 12
+        elif rsi < 35: score += 6
+    else:
+        if rsi > 75:   score += 20
+        elif rsi > 70: score += 12
+        elif rsi > 65: score += 6
+    if rvol > 1.5:   score += 15
+    elif rvol > 1.2: score += 8
+    elif rvol > 1.0: score += 3
+    bonus = {'Bullish Engulf': 20, 'Morning Star': 18, 'Hammer': 15, 'Pin Bar': 12}
+    score += bonus.get(pattern, 0)
+    if dist_support_pct < 2.0:   score += 10
+    elif dist_support_pct < 5.0: score += 5
+    return min(100, score)
+
+
+def evaluate_mean_reversion_symbol(symbol, df, ctx):
+    """
+    Mean Reversion — ค่า indicator ของหุ้น 1 ตัว
+    ctx: {'market': 'SET'/'US', 'screen': True = กรองแบบสแกนเต็ม (สภาพคล่อง / ADX < 25 / RSI นอกโซนกลาง)
+                                          False = แค่คำนวณค่าใหม่ของหุ้นที่อยู่ในตารางแล้ว (refresh_only)}
+    Returns: dict ค่า indicator / คะแนน หรือ None
+    """
+    import logging
+    _log = logging.getLogger('stocks.mean_reversion')
+    market = ctx.get('market', 'SET')
+    screen = ctx.get('screen', True)
+
+    try:
+        if df is None or df.empty or len(df) < 60:
+            return None
+        df = df.dropna(subset=['Close', 'High', 'Low', 'Open'])
+
+        curr    = float(df['Close'].iloc[-1])
+        avg_vol = float(df['Volume'].tail(20).mean())
+        if avg_vol == 0:
+            return None
+
+        # Liquidity filter
+        if screen and market == 'SET' and avg_vol * curr < 500_000:
+            return None
+        if screen and market == 'US' and avg_vol < 200_000:
+            return None
+
+        # ADX filter — must be range-bound
+        adx_v = 30.0
+        try:
+            adf = ta.adx(df['High'], df['Low'], df['Close'], 14)
+            ac  = [c for c in adf.columns if c.startswith('ADX_')]
+            if ac:
+                adx_v = float(adf[ac[0]].iloc[-1])
+        except Exception as e:
+            _log.debug(f'MR ADX {symbol}: {e}')
+        if screen and adx_v >= 25:
+            return None
+
+        # RSI filter
+        rsi_v = 50.0
+        try:
+            rs = ta.rsi(df['Close'], 14)
+            if rs is not None and pd.notna(rs.iloc[-1]):
+                rsi_v = float(rs.iloc[-1])
+        except Exception as e:
+            _log.debug(f'MR RSI {symbol}: {e}')
+
+        if screen and 35 <= rsi_v <= 65:
+            return None   # neutral zone — skip
+
+        direction = 'oversold' if rsi_v < 35 else 'overbought'
+
+        # Pattern detection
+        pattern = _mr_detect_pattern(df)
+
+        # Volume confirmation: rvol
+        rvol = float(df['Volume'].iloc[-1]) / avg_vol if avg_vol > 0 else 1.0
+
+        # Support / Resistance
+        support    = _mr_swing_support(df)
+        resistance = _mr_swing_resistance(df)
+        dist_sup   = ((curr - support) / support * 100) if support else 999.0
+        dist_res   = ((resistance - curr) / curr * 100) if resistance else 999.0
+
+        # Mean target: SMA20
+        mean_tgt = None
+        try:
+            s20 = ta.sma(df['Close'], 20)
+            if s20 is not None and pd.notna(s20.iloc[-1]):
+                mean_tgt = float(s20.iloc[-1])
+        except Exception:
+            pass
+
+        upside = ((mean_tgt - curr) / curr * 100) if mean_tgt and curr > 0 else 0.0
+
+        # 3-month RS raw
+        rs_raw = 0.0
+        if len(df) >= 66:
+            c66 = float(df['Close'].iloc[-66])
+            if c66 > 0:
+                rs_raw = (curr - c66) / c66 * 100
+
+        r_score = _mr_r_score(rsi_v, adx_v, rvol, pattern, direction, dist_sup)
+
+        return {
+            'symbol': symbol, 'price': round(curr, 4),
+            'direction': direction, 'rsi': round(rsi_v, 1),
+            'adx': round(adx_v, 1), 'avg_vol': avg_vol,
+            'rvol': round(rvol, 2), 'pattern': pattern,
+            'support': support, 'resistance': resistance,
+            'dist_sup': round(dist_sup, 2), 'dist_res': round(dist_res, 2),
+            'mean_tgt': mean_tgt, 'upside': round(upside, 2),
+            'rs_raw': rs_raw, 'r_score': r_score,
+        }
+    except Exception as e:
+        _log.debug(f'MR scan {symbol}: {e}')
+        return None
+
+
+def _momentum_indicators(df, ema200_length=200):
+    df['EMA50'] = ta.ema(df['Close'], length=50)
+    df['EMA200'] = ta.ema(df['Close'], length=ema200_length)
+    df['RSI'] = ta.rsi(df['Close'], length=14)
+    adx = ta.adx(df['High'], df['Low'], df['Close'], length=14)
+    if adx is not None:
+        df = pd.concat([df, adx], axis=1)
+    df['MFI'] = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
+    return df
+
+
+def evaluate_momentum_symbol(symbol, df, ctx):
+    """
+    Momentum Scanner (SET) — Stage 2 Technical ของหุ้น 1 ตัว
+    เกณฑ์หลัก: ข้อมูล ≥ 55 แท่ง และ RSI ≥ 35 — ไม่ผ่านลองผ่อนเกณฑ์อีกรอบ (≥ 40 แท่ง / RSI > 30)
+    Returns: dict ชื่อ field เดียวกับ MomentumCandidate (แบบเดียวกับ evaluate_us_momentum_symbol) หรือ None
+    """
+    def _result(h, tech):
+        price = float(h['Close'].iloc[-1])
+        year_high = float(h['High'].tail(252).max())
+        sd = find_supply_demand_zones(h)
+        return {
+            'symbol': symbol, 'price': price,
+            'technical_score': tech.get('score', 0),
+            'rsi': tech.get('rsi', 0),
+            'rvol': tech.get('rvol', 0),
+            'rvol_bullish': tech.get('rvol_bullish', False),
+            'adx': float(h['ADX_14'].iloc[-1]) if 'ADX_14' in h.columns else 0,
+            'mfi': float(h['MFI'].iloc[-1]) if 'MFI' in h.columns else 0,
+            'stage2': price > float(h['EMA200'].iloc[-1]) if 'EMA200' in h.columns else False,
+            'entry_strategy': sd['type'] if sd else '',
+            'demand_zone_start': sd['start'] if sd else None,
+            'demand_zone_end': sd['end'] if sd else None,
+            'supply_zone_start': sd['target'] if sd else None,
+            'supply_zone_end': sd['target'] * 1.02 if sd else None,
+            'stop_loss': sd['stop_loss'] if sd else None,
+            'risk_reward_ratio': sd['rr_ratio'] if sd else None,
+            'year_high': year_high,
+            'upside_to_high': (year_high - price) / price * 100 if price > 0 else 0,
+        }
+
+    if df is None or df.empty:
+        return None
+    try:
+        if len(df) >= 55:
+            h = _momentum_indicators(df.copy())
+            tech = analyze_momentum_technical_v2(h)
+            if tech.get('rsi', 0) >= 35:
+                return _result(h, tech)
+    except Exception:
+        pass
+
+    # FALLBACK: ผ่อนเกณฑ์ให้อีกรอบ (ข้อมูลสั้นถึง 40 แท่ง / RSI > 30)
+    try:
+        if len(df) < 40:
+            return None
+        h = df.copy()
+        h['EMA50'] = ta.ema(h['Close'], length=50)
+        h['EMA200'] = ta.ema(h['Close'], length=min(200, len(h) - 1))
+        h['RSI'] = ta.rsi(h['Close'], length=14)
+        # ADX/MFI ต้องคำนวณใน fallback ด้วย ไม่งั้นตัวที่มาทางนี้ได้ 0 เสมอ
+        try:
+            adx = ta.adx(h['High'], h['Low'], h['Close'], length=14)
+            if adx is not None:
+                h = pd.concat([h, adx], axis=1)
+            h['MFI'] = ta.mfi(h['High'], h['Low'], h['Close'], h['Volume'], length=14)
+        except Exception:
+            pass
+        tech = analyze_momentum_technical_v2(h)
+        if tech.get('rsi', 0) > 30:
+            return _result(h, tech)
+    except Exception:
+        pass
+    return None
+
+
+def evaluate_multi_factor_symbol(symbol, df, ctx):
+    """
+    Multi-Factor Super Score — คะแนน Momentum (40) + Volume/Flow (30) ของหุ้น 1 ตัว
+    (Sentiment AI / Fundamental / sector เติมที่ฝั่งผู้เรียก)
+    ctx: {'market': 'SET'/'US'}
+    """
+    try:
+        if df is None or df.empty:
+            return None
+        df = df.dropna(subset=['Close', 'High'])
+        if len(df) < 60:
+            return None
+        df = df.copy()
+        df['EMA50']  = ta.ema(df['Close'], length=50)
+        df['EMA200'] = ta.ema(df['Close'], length=200)
+        df['RSI']    = ta.rsi(df['Close'], length=14)
+        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
+        if adx_df is not None and not adx_df.empty:
+            df = pd.concat([df, adx_df], axis=1)
+        df['MFI']  = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
+        df['RVOL'] = df['Volume'] / df['Volume'].rolling(20).mean()
+        last    = df.iloc[-1]
+        price   = float(df['Close'].iloc[-1])
+        rsi     = float(last.get('RSI')    or 0) if pd.notna(last.get('RSI'))    else 0
+        adx_val = float(last.get('ADX_14') or 0) if 'ADX_14' in df.columns and pd.notna(last.get('ADX_14')) else 0
+        mfi_val = float(last.get('MFI')    or 0) if pd.notna(last.get('MFI'))    else 0
+        rvol    = float(last.get('RVOL')   or 1) if pd.notna(last.get('RVOL'))   else 1.0
+        ema50   = float(last.get('EMA50')  or 0) if pd.notna(last.get('EMA50'))  else 0
+        ema200  = float(last.get('EMA200') or 0) if pd.notna(last.get('EMA200')) else 0
+        above_ema200 = bool(price > ema200) if ema200 else False
+        above_ema50  = bool(price > ema50)  if ema50  else False
+        mom = 0
+        if above_ema200:                        mom += 15
+        if above_ema50:                         mom += 5
+        if 55 <= rsi <= 72:                     mom += 15
+        elif 45 <= rsi < 55 or 72 < rsi <= 80: mom += 7
+        if adx_val >= 30:                       mom += 5
+        vol = 0
+        if rvol >= 3.0:     vol += 15
+        elif rvol >= 2.0:   vol += 12
+        elif rvol >= 1.5:   vol += 8
+        elif rvol >= 1.0:   vol += 4
+        if mfi_val >= 70:   vol += 15
+        elif mfi_val >= 60: vol += 10
+        elif mfi_val >= 50: vol += 5
+        vol_score = min(vol, 30)
+        return dict(
+            symbol=symbol, price=round(price, 2),
+            market=ctx.get('market', 'SET'),
+            momentum_score=mom, volume_score=vol_score,
+            sentiment_score=0, fundamental_score=0,
+            super_score=mom + vol_score,
+            rsi=round(rsi, 2), adx=round(adx_val, 2),
+            mfi=round(mfi_val, 2), rvol=round(rvol, 2),
+            eps_growth=0.0, rev_growth=0.0,
+            above_ema200=above_ema200, above_ema50=above_ema50,
+        )
+    except Exception as e:
+        import logging
+        logging.getLogger('stocks').warning(f"[MultiFactorScan] {symbol}: {e}")
+        return None
+
+
+def evaluate_us_momentum_symbol(symbol, df, ctx):
+    """
+    US Momentum — Minervini Trend Template + คะแนน Technical ของหุ้น 1 ตัว
+    ctx: {'rs_ratings': {symbol: RS แบบ IBD 0-99}, 'spy_1m': %, 'spy_3m': %}
+    """
+    rs_map = ctx.get('rs_ratings') or {}
+    spy_1m = ctx.get('spy_1m', 0.0)
+    spy_3m = ctx.get('spy_3m', 0.0)
+
+    try:
+        if df is None or df.empty:
+            return None
+        df = df.dropna(subset=['Close', 'High'])
+        if len(df) < 150:
+            return None
+
+        # Liquidity filter - ≥500K avg daily volume
+        av20 = float(df['Volume'].tail(20).mean())
+        if av20 < 500_000:
+            return None
+
+        # Indicators
+        df['EMA50']  = ta.ema(df['Close'], length=50)
+        df['EMA150'] = ta.ema(df['Close'], length=150)
+        df['EMA200'] = ta.ema(df['Close'], length=200)
+        df['RSI']    = ta.rsi(df['Close'], length=14)
+        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
+        if adx_df is not None and not adx_df.empty:
+            df = pd.concat([df, adx_df], axis=1)
+        mfi_s = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
+        if mfi_s is not None:
+            df['MFI'] = mfi_s
+        vol_avg = df['Volume'].rolling(20).mean()
+        df['RVOL'] = df['Volume'] / vol_avg
+
+        last         = df.iloc[-1]
+        current_p    = float(last['Close'])
+        year_high    = float(df['High'].tail(252).max())
+        ema200       = float(last.get('EMA200', 0) or 0)
+        ema50        = float(last.get('EMA50', 0) or 0)
+        rsi_val      = float(last.get('RSI', 50) or 50)
+        adx_val      = float(last['ADX_14']) if 'ADX_14' in df.columns and pd.notna(last.get('ADX_14')) else 0
+        mfi_val      = float(last['MFI']) if 'MFI' in df.columns and pd.notna(last.get('MFI')) else 0
+        rvol_val     = float(last['RVOL']) if pd.notna(last.get('RVOL')) else 1.0
+
+        # ── Minervini Trend Template filters ──────
+        if not (current_p > ema200 and current_p >= year_high * 0.65):
+            return None
+        if adx_val < 15:
+            return None
+
+        rs_v = rs_map.get(symbol, 0)
+
+        # ── Score (0–100) ─────────────────────────
+        score = 0
+        # Trend alignment (max 35)
+        if current_p > ema200:               score += 15
+        if current_p > ema50:                score += 10
+        if ema50 > ema200:                   score += 10
+        # Momentum (max 20)
+        if 55 < rsi_val < 80:                score += 15
+        elif 45 < rsi_val <= 55:             score += 5
+        # Volume/RVOL (max 20)
+        last_close  = float(df['Close'].iloc[-1])
+        prev_close  = float(df['Close'].iloc[-2]) if len(df) > 1 else last_close
+        is_bullish  = last_close >= prev_close
+        if is_bullish and rvol_val >= 1.5:   score += 20
+        elif is_bullish and rvol_val >= 1.0: score += 12
+        elif rvol_val >= 1.0:                score += 5
+        # Price strength (max 10)
+        if current_p >= year_high * 0.90:    score += 10
+        elif current_p >= year_high * 0.80:  score += 5
+        # RS Rating bonus (max 15)
+        if rs_v >= 85:                       score += 15
+        elif rs_v >= 70:                     score += 8
+        elif rs_v >= 60:                     score += 3
+        score = min(score, 100)
+
+        # ── MACD crossover ────────────────────────
+        m_cross = False
+        try:
+            md = ta.macd(df['Close'])
+            if md is not None and not md.empty:
+                mc = md.columns[0]
+                ms = next((c for c in md.columns if 'MACDs' in c), None)
+                if mc and ms:
+                    for i in range(-3, 0):
+                        if md[mc].iloc[i-1] <= md[ms].iloc[i-1] and md[mc].iloc[i] > md[ms].iloc[i]:
+                            m_cross = True
+                            break
+        except Exception:
+            pass
+
+        # ── BB Squeeze ────────────────────────────
+        bb_sqz = False
+        try:
+            bb = ta.bbands(df['Close'])
+            if bb is not None and not bb.empty:
+                bu = next((c for c in bb.columns if 'BBU' in c), None)
+                bl = next((c for c in bb.columns if 'BBL' in c), None)
+                bm = next((c for c in bb.columns if 'BBM' in c), None)
+                if bu and bl and bm:
+                    bw = (bb[bu] - bb[bl]) / bb[bm]
+                    if float(bw.iloc[-1]) <= float(bw.quantile(0.2)):
+                        bb_sqz = True
+        except Exception:
+            pass
+
+        # ── Stage 2 ───────────────────────────────
+        stage2 = False
+        try:
+            s150 = ta.sma(df['Close'], length=150)
+            if s150 is not None and not s150.empty:
+                stage2 = (current_p > float(s150.iloc[-1])) and (float(s150.iloc[-1]) > float(s150.iloc[-20]))
+        except Exception:
+            pass
+
+        # ── Supply / Demand Zone ──────────────────
+        sd_zone = find_supply_demand_zones_v2(df)
+        dz_s = dz_e = sz_s = rr_v = None
+        prox = 999.0
+        if sd_zone:
+            dz_s = sd_zone.get('start')
+            dz_e = sd_zone.get('end')
+            sz_s = sd_zone.get('target')
+            rr_v = sd_zone.get('rr_ratio')
+            if dz_s:
+                prox = 0.0 if current_p <= dz_s else round((current_p - dz_s) / dz_s * 100, 2)
+
+        # ── Relative returns ──────────────────────
+        rel_1m = rel_3m = 0.0
+        cl = df['Close'].dropna()
+        if len(cl) >= 22:
+            rel_1m = round(float((cl.iloc[-1] - cl.iloc[-22]) / cl.iloc[-22] * 100) - spy_1m, 2)
+        if len(cl) >= 66:
+            rel_3m = round(float((cl.iloc[-1] - cl.iloc[-66]) / cl.iloc[-66] * 100) - spy_3m, 2)
+
+        return {
+            'symbol':            symbol,
+            'price':             round(current_p, 2),
+            'technical_score':   score,
+            'rs_rating':         rs_v,
+            'rsi':               round(rsi_val, 2),
+            'adx':               round(adx_val, 2),
+            'mfi':               round(mfi_val, 2),
+            'rvol':              round(rvol_val, 2),
+            'rvol_bullish':      is_bullish and rvol_val >= 1.0,
+            'demand_zone_start': round(dz_s, 2) if dz_s else None,
+            'demand_zone_end':   round(dz_e, 2) if dz_e else None,
+            'supply_zone_start': round(sz_s, 2) if sz_s else None,
+            'risk_reward_ratio': round(rr_v, 2) if rr_v else None,
+            'zone_proximity':    round(prox, 2),
+            'year_high':         round(year_high, 2),
+            'upside_to_high':    round((year_high - current_p) / current_p * 100, 2),
+            'sector':            'Unknown',
+            'stage2':            stage2,
+            'macd_crossover':    m_cross,
+            'bb_squeeze':        bb_sqz,
+            'rel_1m':            rel_1m,
+            'rel_3m':            rel_3m,
+        }
+    except Exception:
+        return None
+
+
+def evaluate_us_sepa_symbol(symbol, df, ctx):
+    """
+    US SEPA — Stage 2 / VCP / VDU / Pocket Pivot ของหุ้น 1 ตัว
+    (เกณฑ์กำไรตาม Minervini ดึงจาก Yahoo ทีละตัว — เป็นงาน I/O ทำที่ฝั่งผู้เรียกเฉพาะตัวที่ผ่านขั้นนี้)
+    """
+    import logging
+    _sepa_log = logging.getLogger('stocks.us_sepa')
+
+    try:
+        if df is None or df.empty: return None
+        df = df.dropna(subset=['Close', 'High', 'Low'])
+        if len(df) < 200: return None
+
+        # Liquidity: avg daily volume ≥ 500K shares
+        if float(df['Volume'].tail(20).mean()) < 500_000: return None
+
+        curr = float(df['Close'].iloc[-1])
+        year_h = float(df['High'].tail(252).max())
+
+        # Stage 2: price > SMA150 AND SMA150 trending up
+        s2 = False
+        try:
+            s150 = ta.sma(df['Close'], 150)
+            if s150 is not None and pd.notna(s150.iloc[-1]) and pd.notna(s150.iloc[-20]):
+                s2 = (curr > float(s150.iloc[-1])) and (float(s150.iloc[-1]) > float(s150.iloc[-20]))
+        except Exception as _e:
+            _sepa_log.debug(f'[US SEPA] SMA150 {symbol}: {_e}')
+        if not s2: return None
+
+        # ADX
+        adx_v = 0.0
+        try:
+            adx_df = ta.adx(df['High'], df['Low'], df['Close'], 14)
+            if adx_df is not None:
+                col = [c for c in adx_df.columns if c.startswith('ADX_')]
+                if col and pd.notna(adx_df[col[0]].iloc[-1]):
+                    adx_v = float(adx_df[col[0]].iloc[-1])
+        except Exception as _e:
+            _sepa_log.debug(f'[US SEPA] ADX {symbol}: {_e}')
+
+        # RSI
+        rsi_v = 50.0
+        try:
+            r = ta.rsi(df['Close'], 14)
+            if r is not None and pd.notna(r.iloc[-1]):
+                rsi_v = float(r.iloc[-1])
+        except Exception as _e:
+            _sepa_log.debug(f'[US SEPA] RSI {symbol}: {_e}')
+
+        # RVOL
+        rvol_v = 1.0
+        try:
+            avg20 = float(df['Volume'].tail(20).mean())
+            if avg20 > 0:
+                rvol_v = round(float(df['Volume'].iloc[-1]) / avg20, 2)
+        except Exception as _e:
+            _sepa_log.debug(f'[US SEPA] RVOL {symbol}: {_e}')
+
+        # VCP
+        vcp = detect_vcp_pattern(df)
+
+        # VDU (Volume Dry-Up near zone)
+        vdu_near = False
+        try:
+            rv5 = float(df['Volume'].tail(5).mean())
+            rv50 = float(df['Volume'].tail(50).mean())
+            vdu_near = (rv5 < rv50 * 0.70) and (curr >= year_h * 0.88)
+        except Exception as _e:
+            _sepa_log.debug(f'[US SEPA] VDU {symbol}: {_e}')
+
+        # Pocket Pivot
+        pp = False
+        try:
+            vols = df['Volume'].values
+            closes = df['Close'].values
+            if len(vols) >= 12:
+                today_vol = vols[-1]
+                today_up  = closes[-1] > closes[-2]
+                dn_vols   = [vols[-(i+2)] for i in range(10) if closes[-(i+2)] < closes[-(i+3)]]
+                if today_up and dn_vols and today_vol > max(dn_vols):
+                    pp = True
+        except Exception as _e:
+            _sepa_log.debug(f'[US SEPA] PocketPivot {symbol}: {_e}')
+
+        return {
+            'symbol': symbol,
+            'price': round(curr, 2),
+            'stage2': True,
+            'vcp_setup': vcp.get('setup', False),
+            'vcp_contractions': vcp.get('contractions', 0),
+            'vcp_tightness': vcp.get('tightness', 0.0),
+            'vcp_vdu': vcp.get('vdu_confirmed', False),
+            'pocket_pivot': pp,
+            'vdu_near_zone': vdu_near,
+            'adx': round(adx_v, 1),
+            'rsi': round(rsi_v, 1),
+            'rvol': rvol_v,
+            'year_high': round(year_h, 2),
+            'upside_to_high': round((year_h - curr) / curr * 100, 2),
+        }
+    except Exception as _e:
+        _sepa_log.debug(f'[US SEPA] scan {symbol}: {_e}')
+        return None
+
+
+def evaluate_cup_handle_symbol(symbol, df, ctx):
+    """
+    Cup & Handle — รูปแบบถ้วย-หูจับ + ADX / RSI / RS 3 เดือน ของหุ้น 1 ตัว ใช้ร่วมกันทั้ง SET และ US
+    ctx: {'min_bars': จำนวนแท่งขั้นต่ำ, 'min_turnover': มูลค่าซื้อขายเฉลี่ย 20 วันขั้นต่ำ (ไม่ใส่ = ไม่กรอง)}
+    """
+    import logging
+    _ch_log = logging.getLogger('stocks.cup_handle')
+    min_turnover = ctx.get('min_turnover')
+
+    try:
+        if df is None or df.empty or len(df) < ctx.get('min_bars', 60):
+            return None
+        df = df.dropna(subset=['Close', 'High', 'Low'])
+
+        avg_vol = float(df['Volume'].tail(20).mean())
+        if min_turnover and avg_vol * float(df['Close'].tail(20).mean()) < min_turnover:
+            return None
+
+        pat = detect_cup_and_handle(df)
+        if pat is None:
+            return None
+
+        # Breakout volume confirmation (O'Neil rule: ≥1.5x avg on breakout day)
+        breakout_vol_ok = False
+        if pat['stage'] == 'breakout':
+            breakout_vol_ok = float(df['Volume'].iloc[-1]) >= avg_vol * 1.5
+
+        # RS return (3M)
+        close_s = df['Close'].dropna()
+        rs_return = None
+        if len(close_s) >= 66:
+            rs_return = float((close_s.iloc[-1] - close_s.iloc[-66]) / abs(close_s.iloc[-66]) * 100)
+
+        # ADX & RSI
+        adx_val, rsi_val = 0.0, 50.0
+        try:
+            adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
+            if adx_df is not None and not adx_df.empty:
+                col = [c for c in adx_df.columns if c.startswith('ADX_')]
+                if col and pd.notna(adx_df[col[0]].iloc[-1]):
+                    adx_val = float(adx_df[col[0]].iloc[-1])
+            rsi_s = ta.rsi(df['Close'], length=14)
+            if rsi_s is not None and pd.notna(rsi_s.iloc[-1]):
+                rsi_val = float(rsi_s.iloc[-1])
+        except Exception as _e:
+            _ch_log.debug(f'[Cup&Handle] ADX/RSI {symbol}: {_e}')
+
+        return {
+            'symbol': symbol, 'pat': pat,
+            'rs_return': rs_return, 'adx': adx_val,
+            'rsi': rsi_val, 'avg_vol': avg_vol,
+            'breakout_vol_ok': breakout_vol_ok,
+        }
+    except Exception as _e:
+        _ch_log.debug(f'[Cup&Handle] scan {symbol}: {_e}')
+        return None
+
+
+def evaluate_supply_demand_zone(symbol, df, ctx):
+    """Demand zone ล่าสุด (find_supply_demand_zones_v2) สำหรับแสดงผลหน้า Momentum — {'symbol', 'zone'} หรือ None"""
+    if df is None or len(df) < 50:
+        return None
+    zone = find_supply_demand_zones_v2(df)
+    return {'symbol': symbol, 'zone': zone} if zone else None
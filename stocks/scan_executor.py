@@ -0,0 +1,228 @@
+# ====== scan_executor.py — รันขั้น CPU ของ scanner ใน process pool แยกจาก web process ======
+# เดิม scanner ทุกตัวรันงานคำนวณ indicator (pandas_ta / VCP / Wyckoff / Ichimoku ...) ใน ThreadPoolExecutor
+# 5–20 worker ภายใน thread ที่แตกออกมาจาก process ของ Daphne — งาน pandas ส่วนใหญ่ถือ GIL
+# จึงได้ CPU แค่ 1 core และแย่ง GIL กับ request ของแอปอื่น (PMS / POS / payroll) ใน process เดียวกัน
+#
+# โมดูลนี้แยก 2 ขั้นออกจากกัน:
+#   - I/O (ดึงแท่งราคา / fundamental / DB) ยังทำในฝั่งผู้เรียกเหมือนเดิม
+#   - CPU (ประเมินทีละหุ้น) ส่งไป process pool ถาวร (forkserver — ไม่ fork ตรงจาก process ที่มีหลาย thread)
+#     แท่งราคาของทั้ง universe แพ็คลง shared memory ก้อนเดียว worker อ่านแท่งของตัวเองจากก้อนนั้น
+#     ไม่ต้อง pickle DataFrame ส่งข้าม process ทีละงาน
+#
+# ใช้งาน:
+#   results = run_cpu_stage(evaluate_fn, symbols, bars, ctx, bar_key=..., on_progress=...)
+#   evaluate_fn ต้องเป็นฟังก์ชันระดับโมดูล รูปแบบ fn(symbol, df, ctx) → ผล (pickle ได้) หรือ None
+#   (ดู stocks/scan_evaluators.py) — ctx ต้อง pickle ได้
+#   งาน CPU อื่นใช้ pool เดียวกันได้ผ่าน get_pool() / reset_pool() (pool พัง) — ไม่ต้องสร้าง pool ของตัวเอง
+#
+# settings (ไม่ใส่ก็ได้):
+#   SCAN_EXECUTOR         'process' (default) หรือ 'thread' (รันใน thread pool แบบเดิม เช่นตอนเทสต์/debug)
+#   SCAN_PROCESS_WORKERS  จำนวน process (default = จำนวน CPU - 1, อย่างน้อย 1)
+
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+_THREAD_WORKERS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# ----------------------------------------------------------------------
+# SharedBars — แท่งราคาหลาย symbol ใน shared memory 2 ก้อน (ค่า OHLCV float64 / วันที่ int64 ns)
+# ----------------------------------------------------------------------
+class SharedBars:
+    """เจ้าของ shared memory ฝั่งผู้เรียก — ใช้กับ with เพื่อให้ unlink เสมอแม้สแกนพัง"""
+
+    def __init__(self, bars):
+        frames = {sym: df for sym, df in bars.items() if df is not None and not df.empty}
+        total = sum(len(df) for df in frames.values())
+        self.offsets = {}
+        self._values = shared_memory.SharedMemory(create=True, size=max(1, total * len(_COLUMNS) * 8))
+        self._dates = shared_memory.SharedMemory(create=True, size=max(1, total * 8))
+        values = np.ndarray((total, len(_COLUMNS)), dtype=np.float64, buffer=self._values.buf)
+        dates = np.ndarray((total,), dtype=np.int64, buffer=self._dates.buf)
+        pos = 0
+        for sym, df in frames.items():
+            n = len(df)
+            values[pos:pos + n] = df.reindex(columns=_COLUMNS).to_numpy(dtype=np.float64)
+            dates[pos:pos + n] = np.asarray(pd.DatetimeIndex(df.index), dtype='datetime64[ns]').view(np.int64)
+            self.offsets[sym] = (pos, n)
+            pos += n
+        self.total = total
+        del values, dates  # ปล่อย view ก่อน close ไม่งั้น close() ไม่ได้
+
+    @property
+    def handle(self):
+        """ข้อมูลที่ worker ต้องใช้ attach (ชื่อ shared memory + ขนาด) — ส่งไปกับทุกงาน ขนาดเล็ก"""
+        return (self._values.name, self._dates.name, self.total)
+
+    def close(self):
+        for shm in (self._values, self._dates):
+            try:
+                shm.close()
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ฝั่ง worker: attach ก้อนล่าสุดค้างไว้ งานถัดไปของสแกนเดียวกันไม่ต้อง attach ใหม่
+_attached = {'handle': None, 'shms': (), 'values': None, 'dates': None}
+
+
+def _open_shared(name):
+    try:
+        # Python 3.13+: ไม่ให้ resource tracker ของ worker ถือสิทธิ์ลบก้อนที่ผู้เรียกเป็นเจ้าของ
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _attach(handle):
+    if _attached['handle'] != handle:
+        for shm in _attached['shms']:
+            shm.close()
+        values_name, dates_name, total = handle
+        shm_v = _open_shared(values_name)
+        shm_d = _open_shared(dates_name)
+        _attached.update({
+            'handle': handle,
+            'shms': (shm_v, shm_d),
+            'values': np.ndarray((total, len(_COLUMNS)), dtype=np.float64, buffer=shm_v.buf),
+            'dates': np.ndarray((total,), dtype=np.int64, buffer=shm_d.buf),
+        })
+    return _attached['values'], _attached['dates']
+
+
+def _frame_from_shared(handle, offset):
+    values, dates = _attach(handle)
+    start, n = offset
+    # copy ออกมาเป็นของงานนี้ — evaluator เติมคอลัมน์/แก้ค่าได้โดยไม่กระทบงานอื่นที่อ่านก้อนเดียวกัน
+    return pd.DataFrame(values[start:start + n].copy(), columns=_COLUMNS,
+                        index=pd.DatetimeIndex(dates[start:start + n].astype('datetime64[ns]'), name='Date'))
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def _run_task(fn, symbol, handle, offset, ctx):
+    try:
+        df = _frame_from_shared(handle, offset) if offset is not None else None
+        return symbol, fn(symbol, df, ctx)
+    except Exception as e:
+        logger.exception("scan_executor %s failed: %s", symbol, e)
+        return symbol, None
+
+
+# ----------------------------------------------------------------------
+# pool
+# ----------------------------------------------------------------------
+def _worker_count():
+    configured = getattr(settings, 'SCAN_PROCESS_WORKERS', None)
+    if configured:
+        return max(1, int(configured))
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def get_pool():
+    """process pool ถาวรของทั้ง process — ใช้ร่วมกับงาน CPU อื่นที่ส่งฟังก์ชันระดับโมดูลได้ (เช่น backtest_engine)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=_worker_count(), mp_context=ctx, initializer=_init_worker)
+        return _pool
+
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(reset_pool)
+
+
+def _run_in_threads(fn, symbols, bars, ctx, bar_key, on_progress):
+    results = {}
+
+    def _one(symbol):
+        try:
+            return fn(symbol, bars.get(bar_key(symbol)), ctx)
+        except Exception as e:
+            logger.exception("scan_executor %s failed: %s", symbol, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=_THREAD_WORKERS) as ex:
+        futures = {ex.submit(_one, sym): sym for sym in symbols}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if on_progress:
+                on_progress(done, len(symbols))
+    return results
+
+
+def run_cpu_stage(fn, symbols, bars, ctx=None, bar_key=None, on_progress=None):
+    """
+    รัน fn(symbol, df, ctx) กับทุก symbol — คืน list ผลที่ไม่ใช่ None เรียงตามลำดับ symbols
+    bars: {key: DataFrame OHLCV} จาก bar_store.get_bars
+    bar_key: symbol → key ใน bars (เช่น lambda s: f"{s}.BK") ไม่ใส่ = ใช้ symbol ตรงๆ
+    on_progress(done, total): เรียกในฝั่งผู้เรียกทุกครั้งที่หุ้นหนึ่งตัวประเมินเสร็จ
+    """
+    symbols = list(symbols)
+    ctx = ctx or {}
+    bar_key = bar_key or (lambda s: s)
+    if not symbols:
+        return []
+
+    results = None
+    if getattr(settings, 'SCAN_EXECUTOR', 'process') == 'process':
+        try:
+            results = _run_in_pool(fn, symbols, bars, ctx, bar_key, on_progress)
+        except Exception as e:
+            # pool พัง (worker ถูก kill / เครื่องไม่รองรับ shared memory) — ไม่ให้สแกนล้มทั้งรอบ
+            logger.warning("scan_executor process pool unavailable, falling back to threads: %s", e)
+            reset_pool()
+    if results is None:
+        results = _run_in_threads(fn, symbols, bars, ctx, bar_key, on_progress)
+    return [results[s] for s in symbols if results.get(s) is not None]
+
+
+def _run_in_pool(fn, symbols, bars, ctx, bar_key, on_progress):
+    needed = {bar_key(s) for s in symbols}
+    results = {}
+    with SharedBars({k: df for k, df in bars.items() if k in needed}) as shared:
+        pool = get_pool()
+        futures = [
+            pool.submit(_run_task, fn, sym, shared.handle, shared.offsets.get(bar_key(sym)), ctx)
+            for sym in symbols
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            symbol, result = future.result()
+            results[symbol] = result
+            if on_progress:
+                on_progress(done, len(symbols))
+    return results
@@ -0,0 +1,207 @@
+# ====== scan_jobs.py — สถานะงานสแกนเบื้องหลัง (progress / lock / push ผ่าน WebSocket) ======
+# เดิม scanner ทุกตัวเขียน progress ด้วย cache.set(ckey, {...}) ทุก chunk และทุก symbol ที่สแกนเสร็จ
+# (เช่นใน ThreadPoolExecutor 20 worker ของ precision_momentum_scanner) ขณะที่หน้าเว็บ poll ?scan_status=1
+# ทุก 2 วินาที — CACHES เป็น DatabaseCache จึงกลายเป็น UPSERT/SELECT ต่อเนื่องบนตาราง django_cache ของ Postgres หลัก
+#
+# โมดูลนี้แยกออกมาเป็นระบบสถานะงานสแกนโดยเฉพาะ:
+#   - สถานะล่าสุดเก็บในหน่วยความจำของ process ที่รันงาน (อ่าน/เขียนได้ทันทีไม่แตะ DB)
+#   - เขียนลงตาราง ScanJob แบบรวบ: ทุกครั้งที่ state เปลี่ยน หรือห่างจากครั้งก่อน ≥ _FLUSH_INTERVAL วินาที
+#     (ให้ process อื่นอ่านสถานะได้ และใช้เป็น lock กันกดสแกนซ้อน)
+#   - push สถานะไปที่ group ของ user ผ่าน Channels (stocks.consumers.ScanStatusConsumer) ไม่ต้อง poll
+#     ถี่สุดทุก _PUSH_INTERVAL วินาที — ใช้ channel layer ใน settings (InMemoryChannelLayer ตอน dev/test)
+#
+# ใช้งาน (แทน cache.add/set/get/delete ของ key สถานะสแกนเดิม ค่า dict หน้าตาเหมือนเดิมทุกอย่าง):
+#   start(key, user_id, {...})  → False ถ้ามีงานเดิมกำลังรันอยู่ (แทน cache.add เป็น lock)
+#   update(key, {...})          → progress ระหว่างสแกน / {'state': 'done'} ตอนจบ
+#   get(key)                    → dict สถานะ (ไม่มี / หมดอายุ → {'state': 'idle'})
+#   clear(key)                  → หน้าเว็บอ่าน done ไปแล้ว รีเซ็ตเป็น idle
+#   snapshot(user_id)           → สถานะปัจจุบันทุกงานของ user (ScanStatusConsumer ส่งให้ทันทีตอน WebSocket ต่อ/ต่อใหม่)
+#
+# stand-in สำหรับ test / dev process เดียว: with local_channel_layer() as layer — แทน channel layer ใน settings ด้วย
+# InMemoryChannelLayer ที่เก็บทุกข้อความที่ push ไว้ใน layer.sent (consumer ที่ต่ออยู่ก็ยังได้รับจริง)
+# ส่วนจังหวะรวบ push / flush อ่านเวลาจาก _clock (แทนด้วยนาฬิกาปลอมใน test ได้)
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone as dj_timezone
+
+from .models import ScanJob
+
+logger = logging.getLogger(__name__)
+
+_IDLE = {'state': 'idle'}
+# เขียนลง DB ถี่สุดกี่วินาทีต่องาน (เว้นแต่ state เปลี่ยน)
+_FLUSH_INTERVAL = 3.0
+# push ผ่าน WebSocket ถี่สุดกี่วินาทีต่องาน (เว้นแต่ state เปลี่ยน)
+_PUSH_INTERVAL = 0.5
+# งานที่ไม่มีความคืบหน้าเกินนี้ถือว่าตายไปแล้ว (process ถูก restart กลางทาง) — ปลด lock ให้สแกนใหม่ได้
+_RUNNING_STALE_AFTER = timedelta(minutes=20)
+# สถานะ done ค้างให้หน้าเว็บมารับได้นานเท่านี้ แล้วค่อยกลับเป็น idle (เท่ากับ timeout=300 ของ cache เดิม)
+_DONE_TTL = timedelta(minutes=5)
+
+GROUP_NAME = 'scan_status_{user_id}'
+
+# นาฬิกาที่ใช้ตัดสินว่าถึงรอบ flush / push หรือยัง
+_clock = time.monotonic
+
+_lock = threading.Lock()
+_local = {}  # key → {'status', 'user_id', 'updated_at', 'flushed_at', 'pushed_at'}
+
+
+def _is_expired(state, updated_at):
+    if updated_at is None:
+        return True
+    age = dj_timezone.now() - updated_at
+    if state == 'running':
+        return age > _RUNNING_STALE_AFTER
+    return age > _DONE_TTL
+
+
+def _push(user_id, key, status):
+    if not user_id:
+        return
+    try:
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        async_to_sync(layer.group_send)(
+            GROUP_NAME.format(user_id=user_id),
+            {'type': 'scan_status', 'job': key, 'status': status},
+        )
+    except Exception as e:
+        logger.debug("scan_jobs push failed for %s: %s", key, e)
+
+
+def start(key, user_id, status):
+    """
+    เริ่มงานใหม่ (แทน cache.add ที่เป็น lock เดิม) — คืน False ถ้ามีงาน key เดียวกันกำลังรันอยู่และยังไม่ตาย
+    """
+    now = dj_timezone.now()
+    fields = {'user_id': user_id, 'state': status.get('state', 'running'), 'status': status,
+              'started_at': now, 'updated_at': now}
+    with _lock, transaction.atomic():
+        job, created = ScanJob.objects.select_for_update().get_or_create(key=key, defaults=fields)
+        if not created:
+            if job.state == 'running' and not _is_expired('running', job.updated_at):
+                return False
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.save(update_fields=list(fields))
+        mono = _clock()
+        _local[key] = {'status': status, 'user_id': user_id, 'updated_at': now, 'flushed_at': mono, 'pushed_at': mono}
+    _push(user_id, key, status)
+    return True
+
+
+def update(key, status):
+    """บันทึกสถานะล่าสุดของงาน — เขียน DB / push แบบรวบตาม _FLUSH_INTERVAL / _PUSH_INTERVAL"""
+    now = dj_timezone.now()
+    mono = _clock()
+    with _lock:
+        entry = _local.get(key)
+        if entry is None:
+            # งานที่ไม่ได้เริ่มผ่าน start() ใน process นี้ — ดึง user จากแถวใน DB (ถ้ามี) มาใช้ push
+            user_id = ScanJob.objects.filter(key=key).values_list('user_id', flat=True).first()
+            entry = _local[key] = {'status': {}, 'user_id': user_id, 'updated_at': now, 'flushed_at': 0.0, 'pushed_at': 0.0}
+        state_changed = entry['status'].get('state') != status.get('state')
+        entry['status'] = status
+        entry['updated_at'] = now
+        flush = state_changed or mono - entry['flushed_at'] >= _FLUSH_INTERVAL
+        push = state_changed or mono - entry['pushed_at'] >= _PUSH_INTERVAL
+        if flush:
+            entry['flushed_at'] = mono
+        if push:
+            entry['pushed_at'] = mono
+        user_id = entry['user_id']
+
+    if flush:
+        try:
+            ScanJob.objects.update_or_create(
+                key=key, defaults={'state': status.get('state', 'running'), 'status': status, 'updated_at': now},
+            )
+        except Exception as e:
+            logger.warning("scan_jobs flush failed for %s: %s", key, e)
+    if push:
+        _push(user_id, key, status)
+
+
+def get(key, default=None):
+    """สถานะล่าสุดของงาน (อ่านจากหน่วยความจำก่อน ไม่มีค่อยอ่านแถว ScanJob)"""
+    default = dict(_IDLE) if default is None else default
+    entry = _local.get(key)
+    if entry is not None and entry['status'].get('state') == 'running':
+        # process นี้เป็นคนรันงานอยู่ — ค่าในหน่วยความจำใหม่กว่าใน DB เสมอ
+        status, updated_at = entry['status'], entry['updated_at']
+    else:
+        row = ScanJob.objects.filter(key=key).values_list('status', 'updated_at').first()
+        if row is None:
+            return default
+        status, updated_at = row
+    if not status or status.get('state') == 'idle' or _is_expired(status.get('state'), updated_at):
+        return default
+    # แนบ key ไปด้วย ให้หน้าเว็บจับคู่กับข้อความที่ push มาทาง WebSocket ได้
+    return {**status, 'job': key}
+
+
+def clear(key):
+    """รีเซ็ตงานเป็น idle (หน้าเว็บรับสถานะ done ไปแล้ว / ยกเลิกงาน)"""
+    with _lock:
+        _local.pop(key, None)
+    ScanJob.objects.filter(key=key).update(state='idle', status=dict(_IDLE), updated_at=dj_timezone.now())
+
+
+def snapshot(user_id):
+    """
+    สถานะปัจจุบันของทุกงานของ user ที่ยังไม่ idle — รวม progress ล่าสุดในหน่วยความจำที่ยังไม่ถึงรอบ push
+    ScanStatusConsumer ส่งให้ทันทีตอนต่อ client ที่หลุดแล้วต่อใหม่จึงไม่พลาดสถานะที่ push ไปตอนไม่ได้ต่ออยู่
+    """
+    keys = set(ScanJob.objects.filter(user_id=user_id).exclude(state='idle').values_list('key', flat=True))
+    with _lock:
+        keys.update(key for key, entry in _local.items() if entry['user_id'] == user_id)
+    statuses = []
+    for key in sorted(keys):
+        status = get(key)
+        if status.get('state') != 'idle':
+            statuses.append(status)
+    return statuses
+
+
+class LocalChannelLayer:
+    """channel layer ใน process เดียว — ส่งต่อให้ InMemoryChannelLayer และเก็บสำเนาทุก group_send ไว้ใน sent"""
+
+    def __init__(self):
+        from channels.layers import InMemoryChannelLayer
+
+        self._layer = InMemoryChannelLayer()
+        self.sent = []
+
+    def __getattr__(self, name):
+        return getattr(self._layer, name)
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+        await self._layer.group_send(group, message)
+
+
+@contextmanager
+def local_channel_layer(alias='default'):
+    """แทน channel layer alias ใน settings ด้วย LocalChannelLayer ระหว่าง with (ทั้ง push ของงานและ consumer)"""
+    from channels.layers import channel_layers
+
+    layer = LocalChannelLayer()
+    old = channel_layers.set(alias, layer)
+    try:
+        yield layer
+    finally:
+        if old is None:
+            channel_layers.backends.pop(alias, None)
+        else:
+            channel_layers.set(alias, old)
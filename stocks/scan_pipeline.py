@@ -0,0 +1,356 @@
+# ====== scan_pipeline.py — โครง pipeline กลางของ scanner (แยกตามตลาดด้วย MarketSpec) ======
+# เดิม scanner แต่ละตัวใน stocks/views/scanners.py เขียนทุกขั้นใหม่หมดในตัวเอง และฝั่ง US เป็นสำเนาของ SET
+# ที่เปลี่ยนแค่ '.BK' / '^SET.BK' → 'SPY' — แก้ประสิทธิภาพขั้นไหนต้องตามแก้ทุกสำเนา (และมักลืมฝั่งใดฝั่งหนึ่ง)
+#
+# โมดูลนี้:
+#   - MarketSpec: ค่าที่ต่างกันระหว่างตลาด (suffix ของ Yahoo, ดัชนีอ้างอิง, การรีเฟรช universe)
+#   - Stage: ขั้นหนึ่งของการสแกน fn(run) อ่าน/เขียน run.state — ทดสอบ/จับเวลาแยกขั้นได้
+#   - ScanPipeline: รันทีละขั้นตามลำดับ จับเวลาทุกขั้นเก็บใน run.timings (log ท้ายรอบ + ส่งไปกับสถานะ done)
+#     run_job(): ห่อการรันของ background thread — เขียนสถานะ done / idle ลง scan_jobs ให้เอง
+#   - stage มาตรฐานที่ใช้ซ้ำได้: universe / scannable_universe → bulk_fetch → index_returns
+#     → rs_prefilter / rs_ratings → deep_evaluate → fundamentals
+#     ขั้นเฉพาะของ scanner (คัดกรองเพิ่ม / บันทึกลงตารางของตัวเอง) และเกณฑ์ที่ต่างกันจริงระหว่างตลาด
+#     ประกาศในโมดูลของ scanner นั้น (ดู stocks/precision_scan.py, momentum_scan.py, cup_handle_scan.py, sepa_scan.py)
+#
+# ใช้งาน:
+#   PIPELINE = ScanPipeline('precision', [universe(400), bulk_fetch(600), ..., Stage('persist', _persist)])
+#   run = ScanRun('US', job_key=..., user=...)
+#   PIPELINE.run(run)   → run.state['results'], run.timings
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable
+
+import numpy as np
+import pytz
+from django.utils import timezone as dj_timezone
+
+from . import scan_jobs
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MarketSpec:
+    code: str                       # ค่า market ในตาราง ('SET' / 'US')
+    bar_suffix: str                 # suffix ของ symbol ฝั่ง Yahoo / คลังแท่งราคา
+    index_symbol: str               # ดัชนีอ้างอิงสำหรับ relative momentum / market condition
+    universe_auto_refresh: bool     # ให้ get_top_ranked_symbols รีเฟรช Market Cap เองระหว่างสแกน
+    refresh_universe_when_empty: bool = False
+    seed_scannable: bool = False    # มีรายชื่อชุดมาตรฐานให้ seed ลง ScannableSymbol เมื่อตารางยังว่าง
+
+    def yahoo(self, symbol):
+        return f"{symbol}{self.bar_suffix}"
+
+    def plain(self, yahoo_symbol):
+        if self.bar_suffix and yahoo_symbol.endswith(self.bar_suffix):
+            return yahoo_symbol[:-len(self.bar_suffix)]
+        return yahoo_symbol
+
+
+MARKETS = {
+    # auto_refresh=False: การรีเฟรช Market Cap ทั้งตลาดใช้เวลานาน (นาที) และเคยทำให้ progress ค้างที่ 0/0
+    # จนหน้าเว็บคิดว่าสแกนตาย — ให้ผู้ใช้กดปุ่ม "รีเฟรช Market Cap" แยกแทน (ยกเว้นยังไม่มีรายชื่อเลย)
+    'SET': MarketSpec('SET', '.BK', '^SET.BK', universe_auto_refresh=False, refresh_universe_when_empty=True),
+    'US': MarketSpec('US', '', 'SPY', universe_auto_refresh=True, seed_scannable=True),
+}
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: Callable
+
+
+class ScanRun:
+    """สถานะของการสแกนหนึ่งรอบ — ส่งต่อระหว่าง stage (run.state) และรายงาน progress ไปที่ scan_jobs"""
+
+    def __init__(self, market, job_key=None, user=None, **state):
+        self.market = MARKETS[market] if isinstance(market, str) else market
+        self.job_key = job_key
+        self.user = user
+        self.started_at = dj_timezone.now()
+        self.state = dict(state)
+        self.timings = {}
+
+    def report(self, progress, phase, total=100):
+        if self.job_key:
+            scan_jobs.update(self.job_key, {'state': 'running', 'progress': progress, 'total': total, 'phase': phase})
+
+
+class ScanPipeline:
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = list(stages)
+
+    def run(self, run):
+        for stage in self.stages:
+            start = time.perf_counter()
+            stage.fn(run)
+            run.timings[stage.name] = round(time.perf_counter() - start, 3)
+        logger.info("[%s/%s] stage timings: %s", self.name, run.market.code,
+                    ' | '.join(f"{name} {sec:.2f}s" for name, sec in run.timings.items()))
+        return run
+
+    def run_job(self, market, user_id, job_key=None):
+        """
+        สแกนทั้งรอบของ user (ใช้เป็น target ของ background thread ใน view)
+        จบแล้วเขียนสถานะ done (จำนวนหุ้นที่ผ่าน + เวลาของแต่ละขั้น) ลง job_key — ล้มกลางทางเขียน idle
+        """
+        from django.contrib.auth import get_user_model
+
+        try:
+            run = self.run(ScanRun(market, job_key=job_key, user=get_user_model().objects.get(pk=user_id)))
+        except Exception as e:
+            logger.exception("[%s/%s] scan failed: %s", self.name, market, e)
+            if job_key:
+                scan_jobs.update(job_key, {'state': 'idle'})
+            return None
+        if job_key:
+            scan_jobs.update(job_key, {'state': 'done', 'count': len(run.state.get('results') or []),
+                                       'timings': run.timings})
+        return run
+
+
+# ----------------------------------------------------------------------
+# stage มาตรฐาน
+# ----------------------------------------------------------------------
+def universe(limit=400):
+    """รายชื่อหุ้น Top Ranked ตาม Market Cap → run.state['symbols']"""
+    def _universe(run):
+        from .utils import get_top_ranked_symbols, refresh_all_thai_symbols
+
+        market = run.market
+        symbols = get_top_ranked_symbols(market=market.code, limit=limit, auto_refresh=market.universe_auto_refresh)
+        if not symbols and market.refresh_universe_when_empty:
+            try:
+                refresh_all_thai_symbols()
+            except Exception:
+                pass
+            symbols = get_top_ranked_symbols(market=market.code, limit=limit, auto_refresh=market.universe_auto_refresh)
+        run.state['symbols'] = list(symbols)
+
+    return Stage('universe', _universe)
+
+
+def scannable_universe(exclude=(), min_symbols=100):
+    """
+    หุ้นที่เปิดสแกนในตาราง ScannableSymbol ของตลาด → run.state['symbols']
+    รายชื่อน้อยกว่า min_symbols และตลาดมีชุดมาตรฐาน (MarketSpec.seed_scannable) → seed ก่อนแล้วอ่านใหม่
+    """
+    def _scannable_universe(run):
+        from .models import ScannableSymbol
+
+        market = run.market
+        qs = ScannableSymbol.objects.filter(is_active=True, market=market.code).values_list('symbol', flat=True)
+        symbols = list(qs)
+        if len(symbols) < min_symbols and market.seed_scannable:
+            from .views.base import _seed_us_symbols
+            _seed_us_symbols()
+            symbols = list(qs)
+        run.state['symbols'] = [s for s in symbols if s not in exclude]
+
+    return Stage('universe', _scannable_universe)
+
+
+def bulk_fetch(lookback_days=600):
+    """
+    เติมหางแท่งราคาของทั้ง universe + ดัชนีอ้างอิงในรอบเดียว → run.state['bars'] ({yahoo symbol: DataFrame})
+    ขั้นถัดไปทุกขั้นอ่านจากชุดเดียวกันนี้ ไม่ยิง Yahoo รายตัวอีก
+    """
+    def _bulk_fetch(run):
+        from .bar_store import get_bars
+
+        market = run.market
+        symbols = run.state['symbols']
+        # ปักวันสแกนตามเวลาไทย — end ของ get_bars เป็น exclusive จึงใช้วันพรุ่งนี้เพื่อให้ได้แท่งของวันนี้
+        today = datetime.now(pytz.timezone('Asia/Bangkok')).date()
+        run.report(2, 'โหลดข้อมูลราคา (เฉพาะส่วนที่ขาด)…', total=len(symbols))
+        run.state['bars'] = get_bars(
+            [market.yahoo(s) for s in symbols] + [market.index_symbol],
+            (today - timedelta(days=lookback_days)).strftime('%Y-%m-%d'),
+            (today + timedelta(days=1)).strftime('%Y-%m-%d'),
+        )
+
+    return Stage('bulk_fetch', _bulk_fetch)
+
+
+def index_returns():
+    """ผลตอบแทน 1 เดือน / 3 เดือนของดัชนีอ้างอิง → run.state['index_1m_return'], ['index_3m_return'] (%)"""
+    def _index_returns(run):
+        ret_1m = ret_3m = 0.0
+        index_symbol = run.market.index_symbol
+        try:
+            df = run.state['bars'].get(index_symbol)
+            if df is not None and not df.empty:
+                close = df['Close'].dropna()
+                if len(close) >= 66:
+                    ret_1m = float((close.iloc[-1] - close.iloc[-22]) / close.iloc[-22] * 100)
+                    ret_3m = float((close.iloc[-1] - close.iloc[-66]) / close.iloc[-66] * 100)
+            logger.info("[ScanPipeline] %s: 1m=%.2f%% 3m=%.2f%%", index_symbol, ret_1m, ret_3m)
+        except Exception as e:
+            logger.warning("[ScanPipeline] %s index returns failed: %s", index_symbol, e)
+        run.state['index_1m_return'] = ret_1m
+        run.state['index_3m_return'] = ret_3m
+
+    return Stage('index_returns', _index_returns)
+
+
+def lookback_returns(bars, symbols, key=None, lookback=66):
+    """
+    ผลตอบแทนย้อนหลัง lookback แท่ง (%) ของทุก symbol ที่มีข้อมูลพอ → {symbol: %}
+    อ่านราคาปิดเป็น ndarray ตรงๆ — ไม่สร้าง Series/ไม่ iloc ต่อหุ้น
+    """
+    key = key or (lambda s: s)
+    out = {}
+    for symbol in symbols:
+        df = bars.get(key(symbol))
+        if df is None:
+            continue
+        close = df['Close'].to_numpy(dtype=np.float64)
+        close = close[~np.isnan(close)]
+        if len(close) >= lookback:
+            base = close[-lookback]
+            out[symbol] = float((close[-1] - base) / abs(base) * 100)
+    return out
+
+
+def rs_prefilter(min_rating=45, lookback=66, snapshot=True):
+    """
+    RS Rating ของ universe แล้วคัดเฉพาะตัวที่ RS >= min_rating ไปขั้นเจาะลึก
+    → run.state['rs_ratings'] (ผลตอบแทน 3 เดือน), run.state['trend_rs_ratings'] (IBD สำหรับ Trend Template),
+      run.state['candidates']
+    snapshot=True: อ่านจาก RelativeStrengthSnapshot ของทั้งตลาด (stocks.rs_engine คำนวณวันละครั้ง)
+    snapshot=False หรือยังไม่มี snapshot: rank ผลตอบแทน lookback แท่งภายใน universe ของรอบนี้จากแท่งในคลัง
+    """
+    def _rs_prefilter(run):
+        from .rs_engine import get_rs_ratings, percentile_ratings
+
+        symbols = run.state['symbols']
+        run.report(15, 'Phase 1: คำนวณ RS Rating...', total=len(symbols))
+        ratings = trend_ratings = {}
+        if snapshot:
+            ratings = get_rs_ratings(run.market.code, 'rs_3m_rating')
+            trend_ratings = get_rs_ratings(run.market.code, 'rs_rating')
+
+        if not ratings:
+            returns = lookback_returns(run.state['bars'], symbols, key=run.market.yahoo, lookback=lookback)
+            # FAILSAFE: ข้อมูลราคาน้อยผิดปกติ (Yahoo ล่ม) — ให้ 100 ตัวแรกผ่านเข้าไปประเมินอย่างน้อย
+            if len(returns) < 10:
+                logger.warning("[ScanPipeline] Data recovery mode: only %d RS returns, forcing fallback", len(returns))
+                for s in symbols[:100]:
+                    returns.setdefault(s, 0.0)
+            ratings = percentile_ratings(returns)
+
+        # ส่งเฉพาะหุ้นของรอบนี้ต่อ — ctx ของ deep_evaluate ถูก pickle ไปกับทุกงานใน process pool
+        ratings = {s: ratings[s] for s in symbols if s in ratings}
+        candidates = [s for s in symbols if ratings.get(s, 0) >= min_rating]
+        if not candidates:
+            candidates = [s for s in symbols if s in ratings] or symbols[:50]
+            logger.warning("[ScanPipeline] RS filter returned 0 — fallback to %d symbols", len(candidates))
+        run.state['rs_ratings'] = ratings
+        run.state['trend_rs_ratings'] = {s: trend_ratings[s] for s in symbols if s in trend_ratings}
+        run.state['candidates'] = candidates
+
+    return Stage('rs_prefilter', _rs_prefilter)
+
+
+def rs_ratings(field='rs_3m_rating', min_rating=None, lookback=66):
+    """
+    RS ของ universe จาก RelativeStrengthSnapshot ของทั้งตลาด → run.state['rs_ratings']
+    field: 'rs_rating' (IBD 4 ไตรมาส) หรือ 'rs_3m_rating' (ผลตอบแทน lookback แท่ง)
+    ยังไม่มี snapshot: คำนวณจากแท่งของรอบนี้ด้วยสูตรเดียวกัน (rank ภายใน universe)
+    min_rating: คัดเฉพาะตัวที่ RS >= min_rating ไปขั้นเจาะลึก → run.state['candidates'] (ไม่ใส่ = ไม่คัด)
+    """
+    def _rs_ratings(run):
+        from .rs_engine import compute_rs_table, get_rs_ratings, percentile_ratings
+
+        market = run.market
+        symbols = run.state['symbols']
+        run.report(15, 'คำนวณ RS Rating…')
+        ratings = get_rs_ratings(market.code, field)
+        if not ratings:
+            bars = run.state['bars']
+            if field == 'rs_rating':
+                table = compute_rs_table(bars, symbols, key=market.yahoo)
+                ratings = table['rs_rating'].dropna().astype(int).to_dict() if 'rs_rating' in table else {}
+            else:
+                ratings = percentile_ratings(lookback_returns(bars, symbols, key=market.yahoo, lookback=lookback))
+            logger.warning("[ScanPipeline] %s %s snapshot unavailable — ranked %d symbols locally",
+                           market.code, field, len(ratings))
+
+        ratings = {s: ratings[s] for s in symbols if s in ratings}
+        run.state['rs_ratings'] = ratings
+        if min_rating is not None:
+            run.state['candidates'] = [s for s in symbols if ratings.get(s, 0) >= min_rating]
+
+    return Stage('rs_ratings', _rs_ratings)
+
+
+def _index_rs_ctx(run):
+    return {
+        'rs_ratings': run.state['rs_ratings'],
+        'trend_rs_ratings': run.state.get('trend_rs_ratings') or {},
+        'index_1m_return': run.state['index_1m_return'],
+        'index_3m_return': run.state['index_3m_return'],
+    }
+
+
+def deep_evaluate(evaluate_fn, ctx=_index_rs_ctx):
+    """
+    ประเมินเชิงลึกทีละหุ้นของ run.state['candidates'] (ไม่มี = ทั้ง universe) ใน process pool (stocks.scan_executor)
+    evaluate_fn(symbol, df, ctx) ต้องเป็นฟังก์ชันระดับโมดูล (ดู stocks/scan_evaluators.py) → run.state['results']
+    ctx(run) → dict ที่ส่งให้ evaluate_fn (ค่าเริ่มต้น: RS + ผลตอบแทนดัชนีจาก rs_prefilter / index_returns)
+    """
+    def _deep_evaluate(run):
+        from .scan_executor import run_cpu_stage
+
+        candidates = run.state['candidates'] if 'candidates' in run.state else run.state['symbols']
+        run.report(25, f'สแกนละเอียด (จำนวน {len(candidates)} ตัว)...')
+
+        def _on_progress(done, total):
+            run.report(25 + int((done / total) * 70), f'สแกนละเอียด {done}/{total}...')
+
+        run.state['results'] = run_cpu_stage(
+            evaluate_fn, candidates, run.state['bars'],
+            ctx=ctx(run),
+            bar_key=run.market.yahoo,
+            on_progress=_on_progress,
+        )
+
+    return Stage('deep_evaluate', _deep_evaluate)
+
+
+def fundamentals():
+    """Sector / EPS growth / Revenue growth ของหุ้นที่ผ่านขั้นเจาะลึก (yahooquery ครั้งเดียวทั้งชุด) → run.state['fundamentals']"""
+    def _fundamentals(run):
+        results = run.state.get('results') or []
+        run.state['fundamentals'] = fund_data = {}
+        if not results:
+            return
+        from yahooquery import Ticker
+
+        market = run.market
+        run.report(95, 'ดึงข้อมูล Fundamental…')
+        try:
+            modules = Ticker([market.yahoo(r['symbol']) for r in results]).get_modules(
+                'financialData summaryProfile defaultKeyStatistics')
+            for yahoo_symbol, data in modules.items():
+                if not isinstance(data, dict):
+                    continue
+                profile = data.get('summaryProfile', {})
+                fin_data = data.get('financialData', {})
+                keystat = data.get('defaultKeyStatistics', {})
+                sector = profile.get('sector') or data.get('assetProfile', {}).get('sector') or 'Unknown'
+                eps_g = keystat.get('earningsQuarterlyGrowth') or fin_data.get('earningsGrowth') or 0.0
+                fund_data[market.plain(yahoo_symbol)] = {
+                    'sector': sector,
+                    'eps_growth': float(eps_g) * 100,
+                    'rev_growth': float(fin_data.get('revenueGrowth', 0) or 0) * 100,
+                }
+        except Exception as e:
+            logger.warning("[ScanPipeline] bulk fundamental fetch failed: %s", e)
+
+    return Stage('fundamentals', _fundamentals)
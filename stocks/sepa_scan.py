@@ -0,0 +1,157 @@
+# ====== sepa_scan.py — Minervini SEPA Scanner (SET / US) บน stocks.scan_pipeline ======
+# เดิม minervini_sepa_scanner (SET) และ us_sepa_scanner (US) มีส่วนแสดงผล/คะแนน SEPA เป็นสำเนากัน
+# และฝั่ง US มี background thread สแกนของตัวเองเขียนทุกขั้นใหม่หมด
+#
+# โมดูลนี้:
+#   - SepaRules: ความต่างระหว่างตลาด — ตารางที่หน้า SEPA อ่าน, สแกนที่ต้องรัน, key ของ scan_jobs
+#     SET: ชั้นกรองบนผลของ PRECISION_PIPELINE (Stage 2 + RS ≥ 70) ไม่มีตารางของตัวเอง
+#     US:  SEPA_PIPELINE ด้านล่าง บันทึกลง USSepaCandidate พร้อมเกณฑ์กำไร (EPS / Revenue / ROE) ของ Minervini
+#   - SEPA_PIPELINE: scannable_universe → bulk_fetch(600 วัน) → rs_ratings(IBD, RS ≥ 60)
+#     → deep_evaluate(evaluate_us_sepa_symbol) → earnings → profiles → persist → prune_history
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from .models import PrecisionScanCandidate, USSepaCandidate
+from .precision_scan import run_precision_scan
+from .scan_evaluators import evaluate_us_sepa_symbol
+from .scan_pipeline import ScanPipeline, Stage, bulk_fetch, deep_evaluate, rs_ratings, scannable_universe
+
+logger = logging.getLogger(__name__)
+
+HISTORY_RUNS = 3
+
+
+def _earnings(run):
+    """
+    เกณฑ์กำไรของ Minervini ของหุ้นที่ผ่านเทคนิคัล — yfinance .info ทีละตัวเป็นงาน I/O จึงใช้ thread pool
+    (เฉพาะตัวที่ผ่านขั้นเจาะลึกแล้ว ไม่ใช่ทั้ง universe)
+    """
+    import yfinance as yf
+
+    results = run.state.get('results') or []
+    rs_map = run.state['rs_ratings']
+
+    def _fetch(r):
+        symbol = r['symbol']
+        r.update(rs_rating=rs_map.get(symbol, 0), eps_growth=0.0, rev_growth=0.0, roe=0.0,
+                 eps_accel=False, earnings_pass=False)
+        try:
+            info = yf.Ticker(symbol).info
+            eps_g = float(info.get('earningsQuarterlyGrowth', 0) or 0) * 100
+            rev_g = float(info.get('revenueGrowth', 0) or 0) * 100
+            roe_v = float(info.get('returnOnEquity', 0) or 0) * 100
+            # EPS Acceleration: trailing EPS เทียบ forward EPS estimate
+            eps_trailing = float(info.get('trailingEps', 0) or 0)
+            eps_forward = float(info.get('forwardEps', 0) or 0)
+            r.update(
+                eps_growth=round(eps_g, 1), rev_growth=round(rev_g, 1), roe=round(roe_v, 1),
+                eps_accel=eps_trailing > 0 and eps_forward > eps_trailing,
+                earnings_pass=(eps_g >= 25) or (rev_g >= 25),
+            )
+        except Exception as e:
+            logger.debug("[US SEPA] earnings %s: %s", symbol, e)
+
+    if results:
+        run.report(95, 'ดึงข้อมูลกำไร…')
+        with ThreadPoolExecutor(max_workers=5) as ex:
+            list(ex.map(_fetch, results))
+
+
+def _profiles(run):
+    """Sector / ชื่อย่อของหุ้นที่ผ่าน (yahooquery ครั้งเดียวทั้งชุด) → run.state['profiles']"""
+    results = run.state.get('results') or []
+    run.state['profiles'] = profiles = {}
+    if not results:
+        return
+    from yahooquery import Ticker
+
+    run.report(97, 'ดึงข้อมูล Sector…')
+    try:
+        modules = Ticker([r['symbol'] for r in results]).get_modules('summaryProfile quoteType')
+        for symbol, data in modules.items():
+            if isinstance(data, dict):
+                profiles[symbol.upper()] = {
+                    'sector': data.get('summaryProfile', {}).get('sector') or 'Unknown',
+                    'name': data.get('quoteType', {}).get('shortName') or '',
+                }
+    except Exception as e:
+        logger.warning("[US SEPA] sector fetch failed: %s", e)
+
+
+def _persist(run):
+    profiles = run.state.get('profiles') or {}
+    USSepaCandidate.objects.bulk_create([USSepaCandidate(
+        user=run.user, scan_run=run.started_at,
+        symbol=r['symbol'],
+        name=profiles.get(r['symbol'], {}).get('name', ''),
+        sector=profiles.get(r['symbol'], {}).get('sector', 'Unknown'),
+        price=r['price'],
+        stage2=r['stage2'],
+        rs_rating=r['rs_rating'],
+        vcp_setup=r['vcp_setup'],
+        vcp_contractions=r['vcp_contractions'],
+        vcp_tightness=r['vcp_tightness'],
+        vcp_vdu=r['vcp_vdu'],
+        pocket_pivot=r['pocket_pivot'],
+        vdu_near_zone=r['vdu_near_zone'],
+        adx=r['adx'],
+        rsi=r['rsi'],
+        rvol=r['rvol'],
+        year_high=r['year_high'],
+        upside_to_high=r['upside_to_high'],
+        eps_growth=r.get('eps_growth', 0.0),
+        rev_growth=r.get('rev_growth', 0.0),
+        roe=r.get('roe', 0.0),
+        eps_accel=r.get('eps_accel', False),
+        earnings_pass=r.get('earnings_pass', False),
+    ) for r in run.state.get('results') or []])
+
+
+def _prune_history(run):
+    qs = USSepaCandidate.objects.filter(user=run.user)
+    old_runs = list(qs.values_list('scan_run', flat=True).distinct().order_by('-scan_run')[HISTORY_RUNS:])
+    if old_runs:
+        qs.filter(scan_run__in=old_runs).delete()
+
+
+SEPA_PIPELINE = ScanPipeline('sepa', [
+    scannable_universe(),
+    bulk_fetch(lookback_days=600),
+    rs_ratings('rs_rating', min_rating=60),  # เก็บถึง RS 60 เผื่อผ่อนเกณฑ์ — หน้า SEPA แสดงเฉพาะ ≥ SepaRules.min_rs
+    deep_evaluate(evaluate_us_sepa_symbol, ctx=lambda run: {}),
+    Stage('earnings', _earnings),
+    Stage('profiles', _profiles),
+    Stage('persist', _persist),
+    Stage('prune_history', _prune_history),
+])
+
+
+def run_sepa_scan(market, user_id, job_key=None):
+    """สแกน US SEPA ทั้งรอบของ user (ดู ScanPipeline.run_job)"""
+    return SEPA_PIPELINE.run_job(market, user_id, job_key)
+
+
+@dataclass(frozen=True)
+class SepaRules:
+    job: str                # prefix ของ key ใน scan_jobs (SET ใช้งานเดียวกับ Precision Scanner)
+    run_scan: Callable      # สแกนของตลาด — target ของ background thread: (market, user_id, job_key)
+    candidates: Callable    # (user, market) → QuerySet ผลสแกนทุกรอบที่หน้า SEPA อ่าน (view กรอง Stage 2 / RS เอง)
+    has_earnings: bool      # มี ROE / EPS acceleration ในผลสแกน (ให้คะแนนเพิ่มใน SEPA Score)
+    min_rs: int = 70        # SEPA criteria: RS Rating ขั้นต่ำที่แสดง
+
+
+RULES = {
+    'SET': SepaRules(
+        'precision_scan', run_precision_scan,
+        lambda user, market: PrecisionScanCandidate.objects.filter(user=user, market=market),
+        has_earnings=False,
+    ),
+    'US': SepaRules(
+        'us_sepa_scan', run_sepa_scan,
+        lambda user, market: USSepaCandidate.objects.filter(user=user),
+        has_earnings=True,
+    ),
+}
@@ -1,3 +1,726 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
+from dataclasses import replace
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from utils.llm_gateway import AnalysisCacheStore, FakeBackend, LLMBusyError, LLMGateway, set_gateway
+
+from . import bar_store, cup_handle_scan, ehlers, momentum_scan, scan_jobs
+from .backtest_engine import run_presets_sweep_universe
+from .models import (
+    AnalysisCache, CupHandleCandidate, MomentumCandidate, PriceBar, RelativeStrengthSnapshot, ScanJob, ScannableSymbol,
+)
+from .rs_engine import compute_rs_table, get_rs_ratings
+from . import scan_evaluators, scan_executor
+from .scan_evaluators import evaluate_precision_symbol
+from .scan_executor import SharedBars, _frame_from_shared, run_cpu_stage
+from .scan_pipeline import MARKETS, ScanPipeline, ScanRun, Stage, deep_evaluate, rs_prefilter
+from .utils import PRESET_DEFINITIONS, run_preset_backtest_universe
+
+
+def _random_walk_bars(rng, n=900):
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0006, 0.02, n)))
+    return pd.DataFrame({
+        'Open': close,
+        'High': close * (1 + rng.uniform(0, 0.03, n)),
+        'Low': close * (1 - rng.uniform(0, 0.03, n)),
+        'Close': close,
+        'Volume': rng.integers(100_000, 10_000_000, n).astype(float),
+    }, index=pd.bdate_range('2021-01-01', periods=n))
+
+
+class PresetBacktestEngineTest(SimpleTestCase):
+    """backtest_engine ต้องให้ผลตรงกับ loop เดิม (_generate_preset_trades) ทุกชุดพารามิเตอร์ และเร็วกว่าชัดเจน"""
+
+    GRID = {'sl_pcts': (2.0, 3.0), 'rr_targets': (1.5, 2.5), 'max_hold_days': (10, 20)}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(42)
+        cls.symbol_dfs = {f'SYM{i}': _random_walk_bars(rng) for i in range(7)}
+        cls.symbol_dfs['SHORT'] = _random_walk_bars(rng, n=150)  # ข้อมูลไม่พอ ต้องถูกข้าม
+
+    def _legacy_sweep(self):
+        return [
+            run_preset_backtest_universe(self.symbol_dfs, preset, sl, rr, hold)
+            for preset in PRESET_DEFINITIONS
+            for sl in self.GRID['sl_pcts']
+            for rr in self.GRID['rr_targets']
+            for hold in self.GRID['max_hold_days']
+        ]
+
+    def test_sweep_matches_legacy_loop(self):
+        legacy = self._legacy_sweep()
+        sweep = run_presets_sweep_universe(self.symbol_dfs, workers=1, **self.GRID)
+        self.assertEqual(len(sweep), len(legacy))
+        self.assertTrue(any(row['trades_count'] for row in legacy))
+        for old, new in zip(legacy, sweep):
+            new = {k: v for k, v in new.items() if k not in ('sl_pct', 'rr_target', 'max_hold_days')}
+            self.assertEqual(new, old)
+
+    def test_process_pool_matches_in_process(self):
+        in_process = run_presets_sweep_universe(self.symbol_dfs, workers=1, **self.GRID)
+        # ใช้ process pool ถาวรของ scan_executor — ไม่สร้าง pool ใหม่ทุกคำขอ
+        with mock.patch('stocks.scan_executor.get_pool', wraps=scan_executor.get_pool) as get_pool:
+            pooled = run_presets_sweep_universe(self.symbol_dfs, workers=2, **self.GRID)
+        get_pool.assert_called_once_with()
+        self.assertIs(scan_executor.get_pool(), scan_executor.get_pool())
+        self.assertEqual(pooled, in_process)
+
+    def test_sweep_speedup_over_legacy_loop(self):
+        start = time.perf_counter()
+        self._legacy_sweep()
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        run_presets_sweep_universe(self.symbol_dfs, workers=1, **self.GRID)
+        engine_seconds = time.perf_counter() - start
+
+        # เครื่องวัดจริงได้ราว 40 เท่า — ตั้งเกณฑ์ไว้ต่ำเพื่อไม่ให้ fail เพราะเครื่อง CI ช้า/แกว่ง
+        self.assertGreater(legacy_seconds / engine_seconds, 5)
+
+
+# ----------------------------------------------------------------------
+# Ehlers DSP — reference เป็น loop ทีละแท่งแบบเดียวกับ calculate_ehlers_* เวอร์ชันก่อนย้ายไป stocks/ehlers.py
+# ----------------------------------------------------------------------
+def _ref_supersmoother(prices, period=15):
+    filt = np.copy(prices)
+    a1 = np.exp(-1.414 * 3.14159 / period)
+    c2 = 2.0 * a1 * np.cos(1.414 * 3.14159 / period)
+    c3 = -a1 * a1
+    c1 = 1.0 - c2 - c3
+    for i in range(2, len(prices)):
+        filt[i] = c1 * (prices[i] + prices[i - 1]) / 2.0 + c2 * filt[i - 1] + c3 * filt[i - 2]
+    return filt
+
+
+def _ref_laguerre_rsi(prices, gamma=0.7):
+    n = len(prices)
+    l0, l1, l2, l3, lrsi = (np.zeros(n) for _ in range(5))
+    for i in range(1, n):
+        l0[i] = (1.0 - gamma) * prices[i] + gamma * l0[i - 1]
+        l1[i] = -gamma * l0[i] + l0[i - 1] + gamma * l1[i - 1]
+        l2[i] = -gamma * l1[i] + l1[i - 1] + gamma * l2[i - 1]
+        l3[i] = -gamma * l2[i] + l2[i - 1] + gamma * l3[i - 1]
+        diffs = (l0[i] - l1[i], l1[i] - l2[i], l2[i] - l3[i])
+        cu = sum(d for d in diffs if d >= 0)
+        cd = sum(-d for d in diffs if d < 0)
+        lrsi[i] = cu / (cu + cd) if cu + cd > 0 else 0.0
+    return lrsi
+
+
+def _ref_fisher(h, l, period=10):
+    n = len(h)
+    value, fish = np.zeros(n), np.zeros(n)
+    for i in range(period - 1, n):
+        minl = np.min(l[i - period + 1:i + 1])
+        diff = (np.max(h[i - period + 1:i + 1]) - minl) or 0.001
+        value[i] = np.clip(0.66 * (((h[i] + l[i]) / 2.0 - minl) / diff - 0.5) + 0.67 * value[i - 1], -0.9999, 0.9999)
+        fish[i] = 0.5 * np.log((1.0 + value[i]) / (1.0 - value[i])) + 0.5 * fish[i - 1]
+    trigger = np.zeros(n)
+    trigger[1:] = fish[:-1]
+    return fish, trigger
+
+
+def _ref_itl(prices, alpha=0.07):
+    itl = np.copy(prices)
+    aa = alpha * alpha
+    for i in range(2, len(prices)):
+        itl[i] = ((alpha - aa / 4.0) * prices[i] + (aa / 2.0) * prices[i - 1] - (alpha - 3.0 * aa / 4.0) * prices[i - 2]
+                  + 2.0 * (1.0 - alpha) * itl[i - 1] - ((1.0 - alpha) ** 2) * itl[i - 2])
+    return itl
+
+
+class EhlersKernelTest(SimpleTestCase):
+    """kernel ใน stocks/ehlers.py ต้องให้ผลเท่ากับ loop เดิม และ batch ต้องเท่ากับเรียกทีละหุ้น"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(7)
+        cls.close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (40, 800)), axis=1))
+        cls.high = cls.close * (1 + rng.uniform(0, 0.02, cls.close.shape))
+        cls.low = cls.close * (1 - rng.uniform(0, 0.02, cls.close.shape))
+        cls.high[:, 300:320] = cls.low[:, 300:320] = cls.close[:, 300:301]  # ช่วงราคานิ่ง diff == 0
+        ehlers.ehlers_batch(cls.close[:1], cls.high[:1], cls.low[:1])  # คอมไพล์ kernel ก่อนจับเวลา
+
+    def _reference(self, row):
+        fish, trig = _ref_fisher(self.high[row], self.low[row])
+        return {
+            'supersmoother': _ref_supersmoother(self.close[row]),
+            'laguerre_rsi': _ref_laguerre_rsi(self.close[row]),
+            'fisher': fish,
+            'trigger': trig,
+            'itl': _ref_itl(self.close[row]),
+        }
+
+    def test_kernels_match_reference_loops(self):
+        for row in range(3):
+            ref = self._reference(row)
+            fish, trig = ehlers.fisher_transform(self.high[row], self.low[row])
+            np.testing.assert_allclose(ehlers.supersmoother(self.close[row]), ref['supersmoother'], rtol=1e-12)
+            np.testing.assert_allclose(ehlers.laguerre_rsi(self.close[row]), ref['laguerre_rsi'], rtol=1e-12)
+            np.testing.assert_allclose(fish, ref['fisher'], rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(trig, ref['trigger'], rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(ehlers.itl(self.close[row]), ref['itl'], rtol=1e-12)
+
+    def test_batch_matches_per_symbol_with_nan_padding(self):
+        close, high, low = self.close.copy(), self.high.copy(), self.low.copy()
+        close[1, :250] = high[1, :250] = low[1, :250] = np.nan  # หุ้นที่ประวัติสั้นกว่า
+        out = ehlers.ehlers_batch(close, high, low)
+        self.assertTrue(np.isnan(out['itl'][1, :250]).all())
+        fish, trig = ehlers.fisher_transform(high[1, 250:], low[1, 250:])
+        np.testing.assert_array_equal(out['fisher'][1, 250:], fish)
+        np.testing.assert_array_equal(out['trigger'][1, 250:], trig)
+        np.testing.assert_array_equal(out['itl'][1, 250:], ehlers.itl(close[1, 250:]))
+        np.testing.assert_array_equal(out['laguerre_rsi'][0], ehlers.laguerre_rsi(close[0]))
+
+    def test_batch_speedup_over_reference_loops(self):
+        start = time.perf_counter()
+        for row in range(len(self.close)):
+            self._reference(row)
+        reference_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ehlers.ehlers_batch(self.close, self.high, self.low)
+        batch_seconds = time.perf_counter() - start
+
+        # วัดจริงได้ระดับร้อยเท่า — เกณฑ์ต่ำไว้กันเครื่อง CI แกว่ง
+        self.assertGreater(reference_seconds / batch_seconds, 3)
+
+
+class VolumeProfileTest(SimpleTestCase):
+    """calculate_volume_profiles: ทุก lookback ในครั้งเดียว และ value area ต้องครอบ POC"""
+
+    def test_profiles_for_all_windows(self):
+        from .utils import VOLUME_PROFILE_WINDOWS, calculate_volume_profile, calculate_volume_profiles
+
+        df = _random_walk_bars(np.random.default_rng(3), n=300)
+        profiles = calculate_volume_profiles(df)
+        self.assertEqual(sorted(profiles), sorted(VOLUME_PROFILE_WINDOWS))
+        for profile in profiles.values():
+            self.assertLessEqual(profile['val'], round(profile['poc'], 2))
+            self.assertGreaterEqual(profile['vah'], round(profile['poc'], 2))
+            self.assertLessEqual(len(profile['hvn']), 3)
+        self.assertEqual(calculate_volume_profile(df), (profiles[120]['poc'], profiles[120]['status']))
+        self.assertEqual(calculate_volume_profiles(df.head(40)), {})
+
+
+class ScanExecutorTest(SimpleTestCase):
+    """process pool + shared memory ต้องให้ผลเหมือนรันใน thread ของ process เดียว"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(11)
+        cls.bars = {f'S{i}.BK': _random_walk_bars(rng, n=400) for i in range(4)}
+        cls.symbols = ['S0', 'S1', 'S2', 'S3', 'MISSING']
+        cls.ctx = {'rs_ratings': {s: 80 for s in cls.symbols}, 'index_1m_return': 1.0, 'index_3m_return': 2.0}
+
+    def test_shared_bars_round_trip(self):
+        df = self.bars['S0.BK']
+        with SharedBars(self.bars) as shared:
+            restored = _frame_from_shared(shared.handle, shared.offsets['S0.BK'])
+        pd.testing.assert_frame_equal(restored, df, check_freq=False, check_names=False, check_index_type=False)
+
+    def test_process_pool_matches_threads(self):
+        progress = []
+        with override_settings(SCAN_EXECUTOR='thread'):
+            threaded = run_cpu_stage(evaluate_precision_symbol, self.symbols, self.bars, self.ctx,
+                                     bar_key=lambda s: f"{s}.BK")
+        pooled = run_cpu_stage(evaluate_precision_symbol, self.symbols, self.bars, self.ctx,
+                               bar_key=lambda s: f"{s}.BK", on_progress=lambda done, total: progress.append(done))
+        self.assertEqual(pooled, threaded)
+        self.assertEqual(progress[-1], len(self.symbols))
+
+    def test_scanner_evaluators_match_threads(self):
+        cases = [
+            (scan_evaluators.evaluate_mean_reversion_symbol, {'market': 'SET', 'screen': False}),
+            (scan_evaluators.evaluate_momentum_symbol, {}),
+            (scan_evaluators.evaluate_multi_factor_symbol, {'market': 'SET'}),
+            (scan_evaluators.evaluate_us_momentum_symbol, {'rs_ratings': {'S0': 90}, 'spy_1m': 1.0, 'spy_3m': 2.0}),
+            (scan_evaluators.evaluate_us_sepa_symbol, {}),
+            (scan_evaluators.evaluate_cup_handle_symbol, {'min_bars': 80}),
+            (scan_evaluators.evaluate_supply_demand_zone, {}),
+        ]
+        for fn, ctx in cases:
+            with self.subTest(fn.__name__):
+                with override_settings(SCAN_EXECUTOR='thread'):
+                    threaded = run_cpu_stage(fn, self.symbols, self.bars, ctx, bar_key=lambda s: f"{s}.BK")
+                pooled = run_cpu_stage(fn, self.symbols, self.bars, ctx, bar_key=lambda s: f"{s}.BK")
+                self.assertEqual(repr(pooled), repr(threaded))
+
+
+class ScanPipelineTest(SimpleTestCase):
+    """stage มาตรฐานของ scan_pipeline ต้องให้ผลเท่ากับโค้ดเดิมใน view และทำงานได้ทั้ง 2 ตลาด"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(5)
+        cls.symbols = [f'S{i}' for i in range(30)]
+        cls.frames = {s: _random_walk_bars(rng, n=300) for s in cls.symbols[:-1]}  # ตัวสุดท้ายไม่มีแท่ง
+
+    def _legacy_ratings(self):
+        returns = {}
+        for s, df in self.frames.items():
+            close = df['Close'].dropna()
+            returns[s] = float((close.iloc[-1] - close.iloc[-66]) / abs(close.iloc[-66]) * 100)
+        return (pd.Series(returns).rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
+
+    def test_market_spec_symbols(self):
+        self.assertEqual(MARKETS['SET'].yahoo('PTT'), 'PTT.BK')
+        self.assertEqual(MARKETS['SET'].plain('PTT.BK'), 'PTT')
+        self.assertEqual(MARKETS['US'].yahoo('AAPL'), 'AAPL')
+        self.assertEqual(MARKETS['US'].plain('AAPL'), 'AAPL')
+
+    def test_rs_prefilter_matches_legacy_for_each_market(self):
+        legacy = self._legacy_ratings()
+        for code in MARKETS:
+            market = MARKETS[code]
+            run = ScanRun(code, symbols=list(self.symbols),
+                          bars={market.yahoo(s): df for s, df in self.frames.items()})
+            ScanPipeline('test', [rs_prefilter(min_rating=45, snapshot=False)]).run(run)
+            self.assertEqual(run.state['rs_ratings'], legacy)
+            self.assertEqual(run.state['candidates'], [s for s in self.symbols if legacy.get(s, 0) >= 45])
+            self.assertIn('rs_prefilter', run.timings)
+
+    def test_deep_evaluate_stage_and_order(self):
+        calls = []
+        run = ScanRun('SET', symbols=list(self.symbols), index_1m_return=1.0, index_3m_return=2.0,
+                      bars={f'{s}.BK': df for s, df in self.frames.items()})
+        pipeline = ScanPipeline('test', [
+            Stage('mark', lambda r: calls.append('mark')),
+            rs_prefilter(min_rating=45, snapshot=False),
+            deep_evaluate(evaluate_precision_symbol),
+        ])
+        with override_settings(SCAN_EXECUTOR='thread'):
+            pipeline.run(run)
+        self.assertEqual(calls, ['mark'])
+        self.assertEqual(list(run.timings), ['mark', 'rs_prefilter', 'deep_evaluate'])
+        expected = run_cpu_stage(evaluate_precision_symbol, run.state['candidates'], run.state['bars'],
+                                 {'rs_ratings': run.state['rs_ratings'], 'index_1m_return': 1.0,
+                                  'index_3m_return': 2.0},
+                                 bar_key=lambda s: f'{s}.BK')
+        self.assertEqual(run.state['results'], expected)
+
+
+class MarketScanPipelineTest(TestCase):
+    """Momentum / Cup & Handle ของ SET และ US รันบน pipeline ชุดเดียวกัน ต่างกันเฉพาะ rules ของตลาด"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('scanner', 'scanner@example.com', 'pw')
+        rng = np.random.default_rng(11)
+        cls.symbols = [f'S{i}' for i in range(25)]
+        cls.frames = {s: _random_walk_bars(rng, n=300) for s in cls.symbols}
+
+    def _fixed_universe(self, rules, **changes):
+        return replace(rules, universe=Stage('universe', lambda run: run.state.update(symbols=list(self.symbols))),
+                       **changes)
+
+    def _run(self, pipeline, code):
+        market = MARKETS[code]
+        with mock.patch('stocks.bar_store.get_bars', return_value={market.yahoo(s): df for s, df in self.frames.items()}), \
+                mock.patch('stocks.rs_engine.get_rs_ratings', return_value={}), \
+                override_settings(SCAN_EXECUTOR='thread'):
+            return pipeline.run(ScanRun(code, user=self.user))
+
+    def test_momentum_rules_per_market(self):
+        for code in MARKETS:
+            with self.subTest(code):
+                rules = self._fixed_universe(momentum_scan.RULES[code], with_fundamentals=False)
+                run = self._run(momentum_scan._pipeline(rules), code)
+
+                # SET ใช้ RS 3 เดือน, US ใช้ RS แบบ IBD — ไม่มี snapshot จึง rank จากแท่งของรอบนี้
+                table = compute_rs_table(self.frames, self.symbols)
+                self.assertEqual(run.state['rs_ratings'], table[rules.rs_field].dropna().astype(int).to_dict())
+
+                rows = {c.symbol: c for c in MomentumCandidate.objects.filter(user=self.user, market=code)}
+                self.assertEqual(sorted(rows), sorted(r['symbol'] for r in run.state['results']))
+                for r in run.state['results']:
+                    row = rows[r['symbol']]
+                    self.assertEqual(row.symbol_bk, MARKETS[code].yahoo(r['symbol']))
+                    self.assertEqual(row.rs_rating, run.state['rs_ratings'].get(r['symbol'], 0))
+                    self.assertEqual(row.technical_score, r['technical_score'])
+
+                # สแกนซ้ำแทนผลเดิมทั้งชุด ไม่สะสม
+                self._run(momentum_scan._pipeline(rules), code)
+                self.assertEqual(MomentumCandidate.objects.filter(user=self.user, market=code).count(), len(rows))
+
+    def test_cup_handle_rules_and_history_per_market(self):
+        day = datetime.date(2024, 1, 2)
+        pat = {
+            'current_price': 10.0, 'cup_high': 12.0, 'cup_low': 8.0, 'cup_depth_pct': 33.0, 'cup_length_days': 60,
+            'cup_start_date': day, 'cup_end_date': day, 'handle_high': 11.8, 'handle_low': 11.0,
+            'handle_depth_pct': 6.8, 'handle_length_days': 8, 'handle_start_date': day, 'breakout_price': 12.1,
+            'target_price': 16.0, 'stop_loss': 10.9, 'risk_reward': 3.2, 'cup_vol_confirmed': True,
+            'handle_vol_dry': True, 'stage': 'breakout', 'confidence_score': 80,
+        }
+        contexts = []
+
+        def fake_stage(fn, symbols, bars, ctx=None, bar_key=None, on_progress=None):
+            contexts.append(ctx)
+            return [{'symbol': 'S0', 'pat': pat, 'rs_return': 5.0, 'adx': 30.0, 'rsi': 60.0,
+                     'avg_vol': 2e6, 'breakout_vol_ok': True}]
+
+        with mock.patch('stocks.scan_executor.run_cpu_stage', side_effect=fake_stage):
+            for code, runs in (('US', 1), ('SET', 5)):
+                pipeline = cup_handle_scan._pipeline(self._fixed_universe(cup_handle_scan.RULES[code]))
+                for _ in range(runs):
+                    run = self._run(pipeline, code)
+
+        self.assertEqual(contexts, [{'min_bars': 60, 'min_turnover': 1_000_000}]
+                         + [{'min_bars': 80, 'min_turnover': 1_000_000}] * 5)
+        # เก็บประวัติ HISTORY_RUNS รอบต่อตลาด — ตัดรอบเก่าของ SET ต้องไม่ลบผลของ US
+        for code, runs in (('SET', cup_handle_scan.HISTORY_RUNS), ('US', 1)):
+            qs = CupHandleCandidate.objects.filter(user=self.user, market=code)
+            self.assertEqual(qs.values('scan_run').distinct().count(), runs)
+        row = CupHandleCandidate.objects.get(user=self.user, market='SET', scan_run=run.started_at)
+        self.assertEqual((row.price, row.rs_rating, row.breakout_vol_ok), (10.0, run.state['rs_ratings']['S0'], True))
+
+
+class RelativeStrengthEngineTest(TestCase):
+    """rs_engine ต้องให้ RS เท่ากับสูตรเดิมของ scanner และคำนวณ snapshot วันละครั้ง"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(9)
+        cls.frames = {f'S{i}.BK': _random_walk_bars(rng, n=300) for i in range(25)}
+        cls.frames['NEW.BK'] = _random_walk_bars(rng, n=100)  # ประวัติไม่ถึง 253 แท่ง
+        for key in cls.frames:
+            ScannableSymbol.objects.create(symbol=key[:-3], market='SET')
+
+    def _legacy(self):
+        ibd, ret_3m = {}, {}
+        for key, df in self.frames.items():
+            cl = df['Close'].dropna()
+            if len(cl) >= 66:
+                ret_3m[key[:-3]] = float((cl.iloc[-1] - cl.iloc[-66]) / abs(cl.iloc[-66]) * 100)
+            if len(cl) >= 253:
+                ibd[key[:-3]] = float(
+                    (cl.iloc[-1] - cl.iloc[-64]) / abs(cl.iloc[-64]) * 0.4 +
+                    (cl.iloc[-64] - cl.iloc[-127]) / abs(cl.iloc[-127]) * 0.2 +
+                    (cl.iloc[-127] - cl.iloc[-190]) / abs(cl.iloc[-190]) * 0.2 +
+                    (cl.iloc[-190] - cl.iloc[-253]) / abs(cl.iloc[-253]) * 0.2
+                ) * 100
+        rank = lambda d: (pd.Series(d).rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
+        return rank(ibd), rank(ret_3m)
+
+    def test_table_matches_legacy_formulas(self):
+        ibd, rs_3m = self._legacy()
+        table = compute_rs_table(self.frames, [k[:-3] for k in self.frames], key=lambda s: f'{s}.BK')
+        self.assertEqual({s: v for s, v in table['rs_rating'].items() if s in ibd}, ibd)
+        self.assertTrue(pd.isna(table.loc['NEW', 'rs_rating']))
+        self.assertTrue(np.isnan(table.loc['NEW', 'rs_score']))
+        self.assertEqual(table['rs_3m_rating'].to_dict(), rs_3m)
+
+    def test_snapshot_built_once_per_day(self):
+        with mock.patch('stocks.bar_store.get_bars', return_value=self.frames) as get_bars:
+            ratings = get_rs_ratings('SET', 'rs_3m_rating')
+            trend_ratings = get_rs_ratings('SET', 'rs_rating')
+        self.assertEqual(get_bars.call_count, 1)
+        self.assertEqual(ratings, self._legacy()[1])
+        self.assertEqual(RelativeStrengthSnapshot.objects.filter(market='SET').count(), len(self.frames))
+        # หุ้นเข้าใหม่: ไม่มี RS แบบ IBD (NULL) → Trend Template ใช้ rank 3 เดือนแทน ไม่ใช่ 0
+        self.assertEqual(trend_ratings, self._legacy()[0])
+        self.assertIsNone(RelativeStrengthSnapshot.objects.get(market='SET', symbol='NEW').rs_rating)
+        self.assertEqual(trend_ratings.get('NEW', ratings.get('NEW', 0)), ratings['NEW'])
+
+    def test_fallback_without_snapshot(self):
+        with mock.patch('stocks.bar_store.get_bars', return_value={}):
+            self.assertEqual(get_rs_ratings('US', fallback={'A': 1.0, 'B': 2.0}), {'A': 49, 'B': 99})
+
+
+class BarStoreReloadTest(TestCase):
+    """หุ้นที่ราคาย้อนหลังเลื่อน (ปันผล/แตกพาร์) ต้องถูกแทนที่ทั้งเส้นเมื่อโหลดใหม่สำเร็จ และต้องไม่หายถ้าโหลดใหม่ไม่ได้"""
+
+    def setUp(self):
+        from django.core.cache import cache
+        from django.utils import timezone as dj_timezone
+
+        cache.clear()
+        today = dj_timezone.localdate()
+        self.old = _random_walk_bars(np.random.default_rng(3), n=600)
+        self.old.index = [d.date() for d in pd.bdate_range(end=today, periods=600)]
+        bar_store._store('AAA.BK', '1d', self.old)
+        self.tail = self.old.tail(5).copy()
+        self.tail[['Open', 'High', 'Low', 'Close']] *= 0.9  # adjusted price ทั้งเส้นเลื่อนลง 10%
+
+    def _refresh(self, full):
+        from django.utils import timezone as dj_timezone
+
+        full_start = dj_timezone.localdate() - pd.Timedelta(days=bar_store._DEFAULT_HISTORY_DAYS)
+
+        def fake_fetch(symbols, start, interval):
+            return full if start == full_start else {'AAA.BK': self.tail}
+
+        with mock.patch.object(bar_store, '_fetch', side_effect=fake_fetch), \
+                mock.patch('stocks.alert_engine.is_market_open', return_value=False):
+            bar_store.refresh_bars(['AAA.BK'])
+
+    def _fresh(self):
+        from django.core.cache import cache
+        return cache.get(bar_store._FRESH_CACHE_KEY.format(interval='1d', symbol='AAA.BK')) is not None
+
+    def test_failed_reload_keeps_bars_and_retries(self):
+        self._refresh(full={})
+        self.assertEqual(PriceBar.objects.filter(symbol='AAA.BK').count(), len(self.old))
+        self.assertAlmostEqual(PriceBar.objects.get(symbol='AAA.BK', date=self.old.index[0]).close,
+                               float(self.old['Close'].iloc[0]))
+        self.assertFalse(self._fresh())
+
+    def test_reload_replaces_history(self):
+        new = self.old.tail(300).copy()
+        new[['Open', 'High', 'Low', 'Close']] *= 0.9
+        self._refresh(full={'AAA.BK': new})
+        self.assertEqual(PriceBar.objects.filter(symbol='AAA.BK').count(), len(new))
+        self.assertAlmostEqual(PriceBar.objects.get(symbol='AAA.BK', date=new.index[0]).close,
+                               float(new['Close'].iloc[0]))
+        self.assertTrue(self._fresh())
+
+
+class _DictStore:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, text, ttl):
+        self.data[key] = text
+
+
+class LLMGatewayTest(SimpleTestCase):
+    """gateway ต้องตอบจาก cache, รวม prompt ซ้ำที่กำลังรอเป็นการเรียกเดียว และไม่เรียกพร้อมกันเกินที่กำหนด"""
+
+    def _run_threads(self, fn, n):
+        results, threads = [None] * n, []
+        for i in range(n):
+            def target(i=i):
+                try:
+                    results[i] = fn(i)
+                except Exception as e:
+                    results[i] = e
+            threads.append(threading.Thread(target=target))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        return results
+
+    def test_cache_hit_and_refresh(self):
+        backend = FakeBackend(reply='ok')
+        gw = LLMGateway(backend, store=_DictStore())
+        self.assertEqual(gw.generate('p', use_case='stock_analysis'), 'ok')
+        self.assertEqual(gw.generate('p', use_case='stock_analysis'), 'ok')
+        self.assertEqual(len(backend.calls), 1)
+        gw.generate('p', use_case='stock_analysis', refresh=True)
+        gw.generate('p', use_case='chatbot')  # TTL 0 — ไม่ cache
+        gw.generate('p', use_case='chatbot')
+        self.assertEqual(len(backend.calls), 4)
+        m = gw.metrics_snapshot()
+        self.assertEqual((m['stock_analysis']['calls'], m['stock_analysis']['cache_hits']), (2, 1))
+
+    def test_identical_inflight_prompts_coalesce(self):
+        backend = FakeBackend(reply='ok', delay=0.3)
+        gw = LLMGateway(backend)
+        results = self._run_threads(lambda i: gw.generate('same', use_case='stock_advisor'), 5)
+        self.assertEqual(results, ['ok'] * 5)
+        self.assertEqual(len(backend.calls), 1)
+        self.assertEqual(gw.metrics_snapshot()['stock_advisor']['coalesced'], 4)
+
+    def test_concurrency_limits(self):
+        active, peak, lock = [0], [0], threading.Lock()
+
+        def reply(model, prompt):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return prompt
+
+        gw = LLMGateway(FakeBackend(reply=reply), max_concurrency=2, max_per_user=10)
+        results = self._run_threads(lambda i: gw.generate(f'p{i}', cache=False), 6)
+        self.assertEqual(results, [f'p{i}' for i in range(6)])
+        self.assertEqual(peak[0], 2)
+
+        gw = LLMGateway(FakeBackend(delay=0.5), max_per_user=1, queue_timeout=0.1)
+        results = self._run_threads(lambda i: gw.generate(f'p{i}', user=7, cache=False), 2)
+        self.assertEqual(sum(isinstance(r, LLMBusyError) for r in results), 1)
+
+    def test_stream_chunks_and_cache(self):
+        backend = FakeBackend(reply='ก' * 100)
+        gw = LLMGateway(backend, store=_DictStore())
+        chunks = list(gw.stream('p', use_case='chart_analysis'))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks), 'ก' * 100)
+        self.assertEqual(list(gw.stream('p', use_case='chart_analysis')), ['ก' * 100])
+        self.assertEqual(gw.generate('p', use_case='chart_analysis'), 'ก' * 100)
+        self.assertEqual(len(backend.calls), 1)
+
+    def test_closed_stream_releases_slot(self):
+        gw = LLMGateway(FakeBackend(reply='x' * 200), store=_DictStore(), max_concurrency=1, queue_timeout=0.1)
+        chunks = gw.stream('p', use_case='chart_analysis')
+        next(chunks)
+        chunks.close()  # ผู้ใช้ปิดหน้า
+        self.assertEqual(gw.generate('q', cache=False), 'x' * 200)
+        self.assertEqual(gw.store.data, {})  # คำตอบไม่ครบต้องไม่ถูก cache
+
+
+class AnalysisCacheStoreTest(TestCase):
+    def test_round_trip_and_expiry(self):
+        store = AnalysisCacheStore()
+        key = LLMGateway.cache_key('m', 'prompt')
+        store.set(key, 'บรรทัดแรก\nบรรทัดสอง', 60)
+        self.assertEqual(store.get(key), 'บรรทัดแรก\nบรรทัดสอง')
+        store.set(key, 'เก่า', 0)
+        self.assertIsNone(store.get(key))
+
+
+class AIStreamEndpointTest(TransactionTestCase):
+    """endpoint SSE ต้องส่งไบต์แรกก่อนเรียก AI, ทยอยส่ง chunk ตามที่ได้รับ และบันทึกข้อความเต็มลง AnalysisCache"""
+
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+
+        self.user = get_user_model().objects.create_superuser('streamer', 'streamer@example.com', 'pw')
+        # login ยิง thread refresh_all_thai_symbols (stocks.signals) ที่เขียน DB พร้อมกับ flush ของเทสต์นี้
+        refresh = mock.patch('stocks.signals.refresh_all_thai_symbols')
+        refresh.start()
+        self.addCleanup(refresh.stop)
+        self.client.force_login(self.user)
+        self.backend = FakeBackend(reply='## แผนขาย\n' + 'ถือรอเบรกเอาต์ ' * 10)
+        self.previous = set_gateway(LLMGateway(self.backend))
+
+    def tearDown(self):
+        set_gateway(self.previous)
+
+    def _events(self, response):
+        import json
+
+        from asgiref.sync import async_to_sync
+
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        body = async_to_sync(read)().decode('utf-8')
+        events = []
+        for block in body.split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.split('\n') if line and not line.startswith(':'))
+            if lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return body, events
+
+    def test_exit_plan_stream(self):
+        response = self.client.get('/stocks/portfolio/exit-plan/ai/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        body, events = self._events(response)
+        self.assertTrue(body.startswith(': open'))
+        chunks = [data['text'] for event, data in events if event == 'chunk']
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(events[-1], ('done', {'text': ''.join(chunks)}))
+        self.assertEqual(len(self.backend.calls), 1)
+        self.assertEqual(AnalysisCache.objects.get(user=self.user, symbol='EXIT_PLAN_AI').analysis_data,
+                         self.backend.reply)
+
+
+class ScanJobsTest(TransactionTestCase):
+    """สถานะงานสแกน: push ระหว่างทางถูกรวบตามรอบ, สถานะสุดท้ายถูกเขียน/ส่งเสมอ, client ที่ต่อใหม่ได้สถานะล่าสุด"""
+
+    KEY = 'precision_scan_test'
+
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+
+        self.user = get_user_model().objects.create_user('scanner', 'scanner@example.com', 'pw')
+        self.now = 0.0
+        clock = mock.patch.object(scan_jobs, '_clock', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.addCleanup(scan_jobs._local.clear)
+
+    def _status(self, progress, state='running'):
+        return {'state': state, 'progress': progress, 'total': 100, 'phase': 'Deep Scan'}
+
+    def test_progress_throttled_and_final_state_flushed(self):
+        def job():
+            # เหมือนงานเบื้องหลังของ scanner: รายงาน progress ทุก symbol แล้วจบด้วย done
+            scan_jobs.start(self.KEY, self.user.id, self._status(0))
+            for i in range(1, 101):
+                self.now += 0.05
+                scan_jobs.update(self.KEY, self._status(i))
+            scan_jobs.update(self.KEY, self._status(100, state='done'))
+
+        with scan_jobs.local_channel_layer() as layer, \
+                mock.patch.object(ScanJob.objects, 'update_or_create', wraps=ScanJob.objects.update_or_create) as flush:
+            worker = threading.Thread(target=job)
+            worker.start()
+            worker.join(10)
+
+        groups = {group for group, _ in layer.sent}
+        pushed = [message['status'] for _, message in layer.sent]
+        self.assertEqual(groups, {f'scan_status_{self.user.id}'})
+        # 101 update ใน 5 วินาที → ราวๆ 1 push ต่อ _PUSH_INTERVAL (0.5 วินาที) ไม่ใช่ทุก update
+        self.assertLessEqual(len(pushed), 13)
+        self.assertGreaterEqual(len(pushed), 10)
+        progress = [status['progress'] for status in pushed]
+        self.assertEqual(progress, sorted(set(progress)))
+        self.assertEqual(pushed[-1], self._status(100, state='done'))
+
+        # DB: ไม่กี่ครั้งตาม _FLUSH_INTERVAL และ done ถูกเขียนเสมอแม้มาทันทีหลังรอบก่อน
+        self.assertLessEqual(flush.call_count, 3)
+        row = ScanJob.objects.get(key=self.KEY)
+        self.assertEqual((row.state, row.status), ('done', self._status(100, state='done')))
+        self.assertEqual(scan_jobs.get(self.KEY), {**self._status(100, state='done'), 'job': self.KEY})
+
+    async def test_reconnecting_client_gets_current_snapshot(self):
+        from channels.db import database_sync_to_async
+        from channels.testing import WebsocketCommunicator
+        from django.contrib.auth import get_user_model
+
+        from .consumers import ScanStatusConsumer
+
+        other = await database_sync_to_async(get_user_model().objects.create_user)('other', 'other@example.com', 'pw')
+        start = database_sync_to_async(scan_jobs.start)
+        update = database_sync_to_async(scan_jobs.update)
+
+        async def connect():
+            communicator = WebsocketCommunicator(ScanStatusConsumer.as_asgi(), '/ws/stocks/scan-status/')
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            return communicator
+
+        with scan_jobs.local_channel_layer():
+            await start('other_scan', other.id, self._status(50))
+            await start(self.KEY, self.user.id, self._status(0))
+
+            first = await connect()
+            self.assertEqual((await first.receive_json_from())['status']['progress'], 0)
+            self.now += 1
+            await update(self.KEY, self._status(40))
+            self.assertEqual((await first.receive_json_from())['status']['progress'], 40)
+            await first.disconnect()
+
+            # ระหว่างหลุด: progress เดินต่อแต่ยังไม่ถึงรอบ push
+            await update(self.KEY, self._status(70))
+            second = await connect()
+            self.assertEqual(await second.receive_json_from(), {
+                'type': 'scan_status', 'job': self.KEY, 'status': {**self._status(70), 'job': self.KEY},
+            })
+            self.assertTrue(await second.receive_nothing())  # งานของ user อื่นไม่ถูกส่งมา
+
+            await update(self.KEY, self._status(100, state='done'))
+            self.assertEqual((await second.receive_json_from())['status']['state'], 'done')
+            await second.disconnect()
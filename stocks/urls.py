@@ -23,6 +23,7 @@ urlpatterns = [
     path('portfolio/dividend/<int:pk>/delete/', views.dividend_delete, name='dividend_delete'),
     path('portfolio/exit-plan/', views.portfolio_exit_plan, name='portfolio_exit_plan'),
     path('portfolio/exit-plan/ai/', views.portfolio_exit_plan_ai_analysis, name='portfolio_exit_plan_ai_analysis'),
+    path('portfolio/exit-plan/ai/stream/', views.portfolio_exit_plan_ai_stream, name='portfolio_exit_plan_ai_stream'),
     path('portfolio/cash/add/', views.add_cash_transaction, name='add_cash_transaction'),
     path('portfolio/cash/<int:pk>/date/', views.update_cash_transaction_date, name='update_cash_transaction_date'),
     path('portfolio/fund/update/', views.update_portfolio_fund, name='update_portfolio_fund'),
@@ -42,6 +43,7 @@ urlpatterns = [
     path('momentum/turnaround/', views.turnaround_scanner, name='turnaround_scanner'),
     path('ai-advisor/', views.stock_ai_advisor, name='stock_ai_advisor'),
     path('api/ai-advisor/', views.api_stock_ai_advisor, name='api_stock_ai_advisor'),
+    path('api/ai-advisor/stream/', views.api_stock_ai_advisor_stream, name='api_stock_ai_advisor_stream'),
     path('momentum/precision/ai/', views.precision_scan_ai_analysis, name='precision_scan_ai_analysis'),
     path('momentum/precision/report/', views.precision_scan_report, name='precision_scan_report'),
     path('momentum/precision/watchlist/', views.scan_watchlist_view, name='scan_watchlist_view'),
@@ -82,6 +84,7 @@ urlpatterns = [
     path('chart/<str:symbol>/', views.stock_chart, name='stock_chart'),
     path('chart/<str:symbol>/data/', views.stock_chart_data, name='stock_chart_data'),
     path('chart/<str:symbol>/ai_analyze/', views.chart_ai_analyze_ajax, name='chart_ai_analyze_ajax'),
+    path('chart/<str:symbol>/ai_analyze/stream/', views.chart_ai_analyze_stream, name='chart_ai_analyze_stream'),
     path('gold-trading/', views.gold_trading, name='gold_trading'),
     path('crypto-trading/', views.crypto_trading, name='crypto_trading'),
     path('debug-scan/<str:symbol>/', views.debug_scan_symbol, name='debug_scan_symbol'),
@@ -1,4 +1,3 @@
-import google.genai as genai
 import logging
 import numpy as np
 import pandas as pd
@@ -7,10 +6,11 @@ logger = logging.getLogger(__name__)
 import pandas_ta as ta
 import requests
 import yfinance as yf
-from django.conf import settings
 from scipy.signal import argrelextrema
 from yahooquery import Ticker as YQTicker
 
+from utils.llm_gateway import generate as llm_generate
+
 # ======================================================================
 # stocks/utils.py — ฟังก์ชันหลักสำหรับวิเคราะห์หุ้นและดึงข้อมูลตลาด
 # ======================================================================
@@ -330,12 +330,14 @@ def run_preset_backtest_universe(symbol_dfs, preset, sl_pct=3.0, rr_target=1.5,
 
 
 def run_all_presets_backtest_universe(symbol_dfs, sl_pct=3.0, rr_target=1.5, max_hold_days=20, period_days=750):
-    """รัน run_preset_backtest_universe กับทุก preset ใน PRESET_DEFINITIONS"""
-    return [
-        run_preset_backtest_universe(symbol_dfs, preset=p, sl_pct=sl_pct, rr_target=rr_target,
-                                      max_hold_days=max_hold_days, period_days=period_days)
-        for p in PRESET_DEFINITIONS
-    ]
+    """
+    ผลเท่ากับรัน run_preset_backtest_universe กับทุก preset ใน PRESET_DEFINITIONS
+    แต่คำนวณ indicator ครั้งเดียวต่อหุ้นและจำลองเทรดแบบ vectorized (stocks.backtest_engine)
+    """
+    from .backtest_engine import run_presets_sweep_universe
+
+    return run_presets_sweep_universe(symbol_dfs, sl_pcts=(sl_pct,), rr_targets=(rr_target,),
+                                      max_hold_days=(max_hold_days,), period_days=period_days)
 
 
 # ----------------------------------------------------------------------
@@ -701,7 +703,9 @@ def compute_fallback_alert_signals(symbol, market='SET'):
 
     sym_bk = symbol if (symbol.endswith('.BK') or market != 'SET') else f"{symbol}.BK"
     try:
-        df = yf.Ticker(sym_bk).history(period="1y", interval="1d", timeout=15)
+        from datetime import date as _date, timedelta as _td
+        from stocks.bar_store import get_symbol_bars
+        df = get_symbol_bars(sym_bk, start=_date.today() - _td(days=365))
     except Exception:
         return None
     if df is None or len(df) < 60:
@@ -1198,7 +1202,7 @@ def _score_commodity_signal(symbol: str, last_price: float, ema200, rsi, macro:
     }
 
 
-def _analyze_commodity_with_ai(symbol: str, data: dict, macro_signal: dict = None) -> str:
+def _analyze_commodity_with_ai(symbol: str, data: dict, macro_signal: dict = None, user=None) -> str:
     """Specialized AI analysis for commodity futures and crypto (GC=F, CL=F, BTC-USD…)."""
     history = data.get('history', pd.DataFrame())
     news    = data.get('news', [])
@@ -1328,9 +1332,7 @@ Technical Snapshot:
 Format in Markdown for a professional web report. Output ONLY raw markdown."""
 
     try:
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
-        response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-        clean_text = response.text
+        clean_text = llm_generate(prompt, use_case='commodity_analysis', model='gemini-2.5-flash', user=user)
         if clean_text.startswith("```markdown"):
             clean_text = clean_text[len("```markdown"):].strip()
         if clean_text.endswith("```"):
@@ -1344,10 +1346,10 @@ Format in Markdown for a professional web report. Output ONLY raw markdown."""
 # analyze_with_ai — วิเคราะห์หุ้นด้วย Gemini AI
 # รวมข้อมูลพื้นฐาน + เทคนิค + ข่าว แล้วส่งให้ AI สรุปเป็นภาษาไทย
 # ----------------------------------------------------------------------
-def analyze_with_ai(symbol, data, extra_context=None, macro_signal=None, mr_context=None):
+def analyze_with_ai(symbol, data, extra_context=None, macro_signal=None, mr_context=None, user=None):
     # Commodity / futures / crypto — use specialized analysis instead
     if _is_commodity(symbol):
-        return _analyze_commodity_with_ai(symbol, data, macro_signal=macro_signal)
+        return _analyze_commodity_with_ai(symbol, data, macro_signal=macro_signal, user=user)
 
     info = data.get('info', {})
     yq = data.get('yq_data', {})
@@ -1541,11 +1543,9 @@ def analyze_with_ai(symbol, data, extra_context=None, macro_signal=None, mr_cont
     Format in Markdown for a professional web report. Ensure clear bullet points, bold key numbers, and output ONLY raw markdown.
     """
 
-    # ส่ง prompt ไปยัง Gemini API และทำความสะอาด Markdown ที่ได้กลับมา
+    # ส่ง prompt ไปยัง Gemini API (ผ่าน LLM gateway) และทำความสะอาด Markdown ที่ได้กลับมา
     try:
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
-        response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-        clean_text = response.text
+        clean_text = llm_generate(prompt, use_case='stock_analysis', model='gemini-2.5-flash', user=user)
         # ลบ code fence ที่ AI บางครั้งใส่มาโดยไม่จำเป็น
         if clean_text.startswith("```markdown"):
             clean_text = clean_text[len("```markdown"):].strip()
@@ -2269,19 +2269,17 @@ def analyze_momentum_technical_v2(df):
     ehlers_itl_bullish_val = False
     try:
         if len(df) >= 30:
-            supersmoother_series = calculate_ehlers_supersmoother(df['Close'].values, period=15)
-            ehlers_supersmoother_val = float(supersmoother_series[-1])
-            
-            laguerre_rsi_series = calculate_ehlers_laguerre_rsi(df['Close'].values, gamma=0.7)
-            ehlers_laguerre_rsi_val = float(laguerre_rsi_series[-1])
-            
-            fisher_series, trigger_series = calculate_ehlers_fisher_transform(df['High'].values, df['Low'].values, period=10)
-            ehlers_fisher_val = float(fisher_series[-1])
-            ehlers_fisher_trigger_val = float(trigger_series[-1])
+            # ทั้ง 4 indicator ในการเรียกครั้งเดียว (kernel numba — stocks/ehlers.py)
+            from stocks.ehlers import ehlers_batch
+            ehlers = ehlers_batch(df['Close'].values, df['High'].values, df['Low'].values,
+                                  ss_period=15, gamma=0.7, fisher_period=10, itl_alpha=0.07)
+            ehlers_supersmoother_val = float(ehlers['supersmoother'][-1])
+            ehlers_laguerre_rsi_val = float(ehlers['laguerre_rsi'][-1])
+            ehlers_fisher_val = float(ehlers['fisher'][-1])
+            ehlers_fisher_trigger_val = float(ehlers['trigger'][-1])
 
             # Instantaneous Trendline (ITL) & Multi-Timeframe (MTF) ITL
-            itl_series = calculate_ehlers_itl(df['Close'].values, alpha=0.07)
-            ehlers_itl_daily_val = float(itl_series[-1])
+            ehlers_itl_daily_val = float(ehlers['itl'][-1])
 
             df_temp = df.copy()
             if not isinstance(df_temp.index, pd.DatetimeIndex):
@@ -2298,12 +2296,17 @@ def analyze_momentum_technical_v2(df):
     except Exception:
         pass
 
+    # Volume Profile ทุก lookback ในครั้งเดียว — ค่าหลัก (POC/VA/nodes) ใช้ 120 แท่งเหมือนเดิม
     poc_price = None
     vp_status = ""
+    vp_profiles = {}
     try:
-        poc_price, vp_status = calculate_volume_profile(df)
+        vp_profiles = calculate_volume_profiles(df)
     except Exception:
         pass
+    vp_main = vp_profiles.get(120) or {}
+    if vp_main:
+        poc_price, vp_status = vp_main['poc'], vp_main['status']
 
     return {
         'score': min(score, 110),
@@ -2344,6 +2347,11 @@ def analyze_momentum_technical_v2(df):
         'ehlers_itl_bullish': ehlers_itl_bullish_val,
         'vp_poc_price': poc_price,
         'vp_status': vp_status,
+        'vp_vah': vp_main.get('vah'),
+        'vp_val': vp_main.get('val'),
+        'vp_hvn': vp_main.get('hvn', []),
+        'vp_lvn': vp_main.get('lvn', []),
+        'vp_profiles': {str(w): p for w, p in vp_profiles.items()},
     }
 
 
@@ -2908,27 +2916,8 @@ def calculate_ehlers_supersmoother(prices, period=15):
     Ehlers 2-Pole SuperSmoother Filter
     Grants superior noise filtering compared to standard EMA or SMA with minimal lag.
     """
-    import math
-
-    import numpy as np
-    prices = np.asarray(prices, dtype=float)
-    n = len(prices)
-    filt = np.copy(prices)
-    if n < 3:
-        return filt
-    
-    # Calculate constant coefficients
-    a1 = math.exp(-1.414 * 3.14159 / period)
-    # Cosine expects radians. In Ehlers books, he sometimes writes degrees but 
-    # math.cos expects radians. The correct coefficient formula in radians is:
-    b1 = 2.0 * a1 * math.cos(1.414 * 3.14159 / period)
-    c2 = b1
-    c3 = -a1 * a1
-    c1 = 1.0 - c2 - c3
-    
-    for i in range(2, n):
-        filt[i] = c1 * (prices[i] + prices[i-1]) / 2.0 + c2 * filt[i-1] + c3 * filt[i-2]
-    return filt
+    from stocks.ehlers import supersmoother
+    return supersmoother(prices, period)
 
 
 def calculate_ehlers_laguerre_rsi(prices, gamma=0.7):
@@ -2936,38 +2925,8 @@ def calculate_ehlers_laguerre_rsi(prices, gamma=0.7):
     Ehlers 4-Element Laguerre RSI
     Offers low-lag, smooth momentum signals. gamma values between 0.7 and 0.8 are recommended.
     """
-    import numpy as np
-    prices = np.asarray(prices, dtype=float)
-    n = len(prices)
-    l0 = np.zeros(n)
-    l1 = np.zeros(n)
-    l2 = np.zeros(n)
-    l3 = np.zeros(n)
-    lrsi = np.zeros(n)
-    if n < 2:
-        return lrsi
-        
-    for i in range(1, n):
-        l0[i] = (1.0 - gamma) * prices[i] + gamma * l0[i-1]
-        l1[i] = -gamma * l0[i] + l0[i-1] + gamma * l1[i-1]
-        l2[i] = -gamma * l1[i] + l1[i-1] + gamma * l2[i-1]
-        l3[i] = -gamma * l2[i] + l2[i-1] + gamma * l3[i-1]
-        
-        cu = 0.0
-        cd = 0.0
-        if l0[i] >= l1[i]: cu += l0[i] - l1[i]
-        else: cd += l1[i] - l0[i]
-        if l1[i] >= l2[i]: cu += l1[i] - l2[i]
-        else: cd += l2[i] - l1[i]
-        if l2[i] >= l3[i]: cu += l2[i] - l3[i]
-        else: cd += l3[i] - l2[i]
-        
-        if cu + cd > 0:
-            lrsi[i] = cu / (cu + cd)
-        else:
-            lrsi[i] = 0.0
-            
-    return lrsi
+    from stocks.ehlers import laguerre_rsi
+    return laguerre_rsi(prices, gamma)
 
 
 def calculate_ehlers_fisher_transform(prices_high, prices_low, period=10):
@@ -2977,36 +2936,8 @@ def calculate_ehlers_fisher_transform(prices_high, prices_low, period=10):
     Helps locate turning points (mean reversion) with high accuracy.
     Returns: (fisher, trigger)
     """
-    import numpy as np
-    h = np.asarray(prices_high, dtype=float)
-    l = np.asarray(prices_low, dtype=float)
-    n = len(h)
-    value = np.zeros(n)
-    fish = np.zeros(n)
-    if n < period:
-        return fish, fish
-        
-    for i in range(period - 1, n):
-        sub_h = h[i - period + 1 : i + 1]
-        sub_l = l[i - period + 1 : i + 1]
-        maxh = np.max(sub_h)
-        minl = np.min(sub_l)
-        diff = maxh - minl
-        if diff == 0:
-            diff = 0.001
-            
-        curr_val = 0.66 * ((( (h[i] + l[i]) / 2.0 - minl) / diff - 0.5)) + 0.67 * value[i-1]
-        if curr_val > 0.9999:
-            curr_val = 0.9999
-        elif curr_val < -0.9999:
-            curr_val = -0.9999
-        value[i] = curr_val
-        
-        fish[i] = 0.5 * np.log((1.0 + value[i]) / (1.0 - value[i])) + 0.5 * fish[i-1]
-        
-    trigger = np.zeros(n)
-    trigger[1:] = fish[:-1]
-    return fish, trigger
+    from stocks.ehlers import fisher_transform
+    return fisher_transform(prices_high, prices_low, period)
 
 
 def calculate_ehlers_itl(prices, alpha=0.07):
@@ -3015,23 +2946,8 @@ def calculate_ehlers_itl(prices, alpha=0.07):
     Uses a digital filter to reject cycle components, revealing the underlying trend.
     Formula: ITL = (a - a^2 / 4)*Price + (a^2 / 2)*Price[1] - (a - 3*a^2 / 4)*Price[2] + 2*(1-a)*ITL[1] - (1-a)^2 * ITL[2]
     """
-    import numpy as np
-    prices = np.asarray(prices, dtype=float)
-    n = len(prices)
-    itl = np.copy(prices)
-    if n < 3:
-        return itl
-        
-    aa = alpha * alpha
-    c1 = alpha - aa / 4.0
-    c2 = aa / 2.0
-    c3 = alpha - 3.0 * aa / 4.0
-    d1 = 2.0 * (1.0 - alpha)
-    d2 = - ((1.0 - alpha) ** 2)
-    
-    for i in range(2, n):
-        itl[i] = c1 * prices[i] + c2 * prices[i-1] - c3 * prices[i-2] + d1 * itl[i-1] + d2 * itl[i-2]
-    return itl
+    from stocks.ehlers import itl
+    return itl(prices, alpha)
 
 
 def classify_ehlers_pattern(lrsi, fisher, trig, price, ss):
@@ -3078,55 +2994,124 @@ def classify_ehlers_pattern(lrsi, fisher, trig, price, ss):
 
 
 
+# ----------------------------------------------------------------------
+# Volume Profile — กระจาย volume ตามระดับราคา (typical price) ของช่วงย้อนหลัง
+# คำนวณทุก lookback ด้วย np.bincount ครั้งเดียว: แต่ละ window ได้ bin ของตัวเอง (min/max ของช่วงนั้น)
+# แล้วเลื่อน index ไปคนละช่วงของ array เดียวกัน
+# ----------------------------------------------------------------------
+VOLUME_PROFILE_WINDOWS = (20, 60, 120, 250)
+
+
+def _vp_status(current_price, poc_price):
+    margin = poc_price * 0.03  # 3% margin
+    if current_price > poc_price + margin:
+        return 'Breakout POC'
+    if current_price < poc_price - margin:
+        return 'Below POC'
+    return 'At POC'
+
+
+def _vp_value_area(volume_by_bin, poc_idx, value_area):
+    """ขยายจาก POC ไปฝั่งที่ volume มากกว่าทีละ bin จนครอบคลุม value_area ของ volume ทั้งหมด → (lo_idx, hi_idx)"""
+    target = volume_by_bin.sum() * value_area
+    lo = hi = poc_idx
+    covered = volume_by_bin[poc_idx]
+    last = len(volume_by_bin) - 1
+    while covered < target and (lo > 1 or hi < last):
+        below = volume_by_bin[lo - 1] if lo > 1 else -1.0
+        above = volume_by_bin[hi + 1] if hi < last else -1.0
+        if above >= below:
+            hi += 1
+            covered += above
+        else:
+            lo -= 1
+            covered += below
+    return lo, hi
+
+
+def _vp_nodes(volume_by_bin, centers, top=3):
+    """HVN = ยอดเขาของ histogram (volume ≥ ค่าเฉลี่ย), LVN = หุบเขาระหว่างช่วงที่มีการซื้อขาย (volume ≤ ครึ่งของค่าเฉลี่ย)"""
+    vol = volume_by_bin[1:]
+    traded = np.flatnonzero(vol > 0)
+    if len(traded) < 3:
+        return [], []
+    mean_vol = vol[traded].mean()
+    padded = np.concatenate([[-np.inf], vol, [-np.inf]])
+    peaks = np.flatnonzero((vol > padded[:-2]) & (vol >= padded[2:]) & (vol >= mean_vol))
+    inside = np.arange(traded[0] + 1, traded[-1])
+    troughs = inside[(vol[inside] <= vol[inside - 1]) & (vol[inside] < vol[inside + 1]) & (vol[inside] <= mean_vol * 0.5)]
+    hvn = [round(float(centers[i + 1]), 2) for i in peaks[np.argsort(-vol[peaks], kind='stable')][:top]]
+    lvn = [round(float(centers[i + 1]), 2) for i in troughs[np.argsort(vol[troughs], kind='stable')][:top]]
+    return hvn, lvn
+
+
+def calculate_volume_profiles(df, windows=VOLUME_PROFILE_WINDOWS, bins=50, value_area=0.70):
+    """
+    Volume Profile ของหลาย lookback ในครั้งเดียว
+    Returns: {window: {'poc', 'vah', 'val', 'hvn': [..], 'lvn': [..], 'status'}}
+      window ที่ข้อมูลไม่พอ (< 50 แท่ง หรือราคาไม่เคลื่อนไหว) จะไม่อยู่ใน dict
+    การแบ่ง bin / ตำแหน่ง POC เหมือน calculate_volume_profile เดิม (linspace bins จุด + bin สุดท้ายสำหรับราคาสูงสุด)
+    """
+    if df is None or len(df) < 50 or not {'High', 'Low', 'Close', 'Volume'}.issubset(df.columns):
+        return {}
+
+    typical = ((df['High'] + df['Low'] + df['Close']) / 3).to_numpy(dtype=float)
+    volume = df['Volume'].to_numpy(dtype=float)
+    current_price = float(df['Close'].iloc[-1])
+    n = len(typical)
+    width = bins + 1
+
+    plans = []  # (window, mask ของแถวที่ใช้, min_p, max_p, edges)
+    idx_parts, vol_parts = [], []
+    for window in windows:
+        start = max(0, n - window)
+        tp, vol = typical[start:], volume[start:]
+        mask = ~(np.isnan(tp) | np.isnan(vol))
+        if not mask.any():
+            continue
+        tp, vol = tp[mask], vol[mask]
+        min_p, max_p = float(tp.min()), float(tp.max())
+        if max_p == min_p:
+            continue
+        edges = np.linspace(min_p, max_p, bins)
+        idx_parts.append(np.digitize(tp, edges) + len(plans) * width)
+        vol_parts.append(vol)
+        plans.append((window, min_p, max_p, edges))
+    if not plans:
+        return {}
+
+    volume_by_bin = np.bincount(np.concatenate(idx_parts), weights=np.concatenate(vol_parts),
+                                minlength=len(plans) * width).reshape(len(plans), width)
+
+    profiles = {}
+    for k, (window, min_p, max_p, edges) in enumerate(plans):
+        vbb = volume_by_bin[k]
+        bin_size = (max_p - min_p) / bins
+        # ราคากลางของแต่ละ bin (index 0 = ต่ำกว่า min ไม่เกิดขึ้นจริง, index bins = ราคาเท่ากับ max พอดี)
+        centers = np.concatenate([[min_p], edges[:-1] + bin_size / 2, [max_p]])
+        upper = np.concatenate([[min_p], edges[1:], [max_p]])
+        lower = np.concatenate([[min_p], edges])
+
+        poc_idx = int(np.argmax(vbb))
+        poc_price = float(centers[poc_idx])
+        lo, hi = _vp_value_area(vbb, poc_idx, value_area)
+        hvn, lvn = _vp_nodes(vbb, centers)
+        profiles[window] = {
+            'poc': poc_price,
+            'vah': round(float(upper[hi]), 2),
+            'val': round(float(lower[lo]), 2),
+            'hvn': hvn,
+            'lvn': lvn,
+            'status': _vp_status(current_price, poc_price),
+        }
+    return profiles
+
+
 def calculate_volume_profile(df, bins=50):
-    import numpy as np
-    import pandas as pd
+    """POC ของ 120 แท่งล่าสุด + สถานะราคาเทียบ POC → (poc_price, vp_status) หรือ (None, None)"""
     if df is None or len(df) < 50:
         return None, None
-    vp_df = df.tail(120).copy()
-    if 'High' not in vp_df or 'Low' not in vp_df or 'Volume' not in vp_df:
-        return None, None
-        
-    vp_df['Typical_Price'] = (vp_df['High'] + vp_df['Low'] + vp_df['Close']) / 3
-    vp_df = vp_df.dropna(subset=['Typical_Price', 'Volume'])
-    
-    if len(vp_df) == 0:
+    profile = calculate_volume_profiles(df, windows=(120,), bins=bins).get(120)
+    if profile is None:
         return None, None
-        
-    min_p = float(vp_df['Typical_Price'].min())
-    max_p = float(vp_df['Typical_Price'].max())
-    
-    if pd.isna(min_p) or pd.isna(max_p) or max_p == min_p:
-        return None, None
-        
-    bin_size = (max_p - min_p) / bins
-    vp_bins = np.linspace(min_p, max_p, bins)
-    inds = np.digitize(vp_df['Typical_Price'], vp_bins)
-    volume_by_bin = np.zeros(bins + 1)
-    
-    for i in range(len(vp_df)):
-        vol = float(vp_df['Volume'].iloc[i])
-        idx = inds[i]
-        if idx <= bins:
-            volume_by_bin[idx] += vol
-        else:
-            volume_by_bin[bins] += vol
-            
-    poc_idx = np.argmax(volume_by_bin)
-    if poc_idx == 0:
-        poc_price = float(min_p)
-    elif poc_idx >= bins:
-        poc_price = float(max_p)
-    else:
-        poc_price = float(vp_bins[poc_idx-1] + (bin_size / 2))
-        
-    current_price = float(df['Close'].iloc[-1])
-    margin = poc_price * 0.03 # 3% margin
-    if current_price > poc_price + margin:
-        vp_status = 'Breakout POC'
-    elif current_price < poc_price - margin:
-        vp_status = 'Below POC'
-    else:
-        vp_status = 'At POC'
-        
-    return poc_price, vp_status
+    return profile['poc'], profile['status']
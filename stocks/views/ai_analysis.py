@@ -315,7 +315,8 @@ def portfolio_exit_plan(request):
         _mc_now   = _mcdt.now(_mc_bkk)
         _mc_end   = _mc_now.date().strftime('%Y-%m-%d')
         _mc_start = (_mc_now.date() - _mctd(days=430)).strftime('%Y-%m-%d')
-        _mc_df = yf.download("^SET.BK", start=_mc_start, end=_mc_end, interval="1d", progress=False)
+        from stocks.bar_store import get_symbol_bars
+        _mc_df = get_symbol_bars("^SET.BK", _mc_start, _mc_end)
         if _mc_df is not None and not _mc_df.empty:
             if isinstance(_mc_df.columns, pd.MultiIndex):
                 _mc_df.columns = _mc_df.columns.droplevel(1)
@@ -336,17 +337,13 @@ def portfolio_exit_plan(request):
 
 
 # ====== Portfolio Exit Plan AI Analysis ======
-@login_required
-def portfolio_exit_plan_ai_analysis(request):
-    """
-    สร้าง AI Analysis สำหรับ Portfolio Exit Plan ผ่าน AJAX
-    """
-    portfolio_items = Portfolio.objects.filter(user=request.user)
+def _exit_plan_prompt(user):
+    portfolio_items = Portfolio.objects.filter(user=user)
     port_str = ""
     for item in portfolio_items:
         clean_symbol = item.symbol.split('.')[0].upper()
         from stocks.models import PrecisionScanCandidate
-        prec_data = PrecisionScanCandidate.objects.filter(user=request.user, symbol=clean_symbol).order_by('-scan_run').first()
+        prec_data = PrecisionScanCandidate.objects.filter(user=user, symbol=clean_symbol).order_by('-scan_run').first()
         port_str += f"- Symbol: {item.symbol}, Qty: {item.quantity}, Entry Price: {item.entry_price}, Strategy: {item.strategy or 'Precision/Breakout'}\n"
         if prec_data:
             port_str += f"  RSI: {prec_data.rsi}, ADX: {prec_data.adx}, RVOL: {prec_data.rvol}, Rel Mom 3m: {prec_data.rel_momentum_3m}, Stop Loss: {prec_data.stop_loss}, Take Profit (Resistance/High): {prec_data.supply_zone_start}\n"
@@ -379,23 +376,50 @@ def portfolio_exit_plan_ai_analysis(request):
     2. Analyze each stock one by one.
     3. Do NOT include conversational preamble.
     """
-    
+    return prompt
+
+
+def _strip_markdown_fence(text):
+    if text.startswith("```markdown"):
+        text = text[len("```markdown"):].strip()
+    if text.endswith("```"):
+        text = text[:-3].strip()
+    return text
+
+
+@login_required
+def portfolio_exit_plan_ai_analysis(request):
+    """
+    สร้าง AI Analysis สำหรับ Portfolio Exit Plan ผ่าน AJAX
+    """
+    prompt = _exit_plan_prompt(request.user)
+
     try:
         model_name_to_use = "gemini-2.5-flash"
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
-        response = client.models.generate_content(
-            model=model_name_to_use,
-            contents=prompt
-        )
-        ai_analysis = response.text
-        if ai_analysis.startswith("```markdown"):
-            ai_analysis = ai_analysis[len("```markdown"):].strip()
-        if ai_analysis.endswith("```"):
-            ai_analysis = ai_analysis[:-3].strip()
-        return JsonResponse({'success': True, 'analysis': ai_analysis})
+        ai_analysis = llm_generate(prompt, use_case='portfolio_analysis', model=model_name_to_use, user=request.user)
+        return JsonResponse({'success': True, 'analysis': _strip_markdown_fence(ai_analysis)})
     except Exception as e:
         return JsonResponse({'success': False, 'error': f"AI Error: {str(e)}"})
 
+
+@login_required
+def portfolio_exit_plan_ai_stream(request):
+    """portfolio_exit_plan_ai_analysis แบบ SSE — บันทึกผลล่าสุดลง AnalysisCache (EXIT_PLAN_AI)"""
+    from utils.llm_stream import sse_response, stream_llm
+
+    user = request.user
+
+    def persist(text):
+        AnalysisCache.objects.update_or_create(user=user, symbol='EXIT_PLAN_AI', defaults={'analysis_data': text})
+
+    def events():
+        prompt = _exit_plan_prompt(user)
+        yield 'status', {'message': 'AI กำลังวิเคราะห์พอร์ต...'}
+        yield from stream_llm(prompt, 'portfolio_analysis', 'gemini-2.5-flash', user=user,
+                              clean=_strip_markdown_fence, persist=persist)
+
+    return sse_response(events)
+
 # ====== Portfolio Management - เพิ่ม/ลบ รายการพอร์ต ======
 
 @login_required
@@ -443,9 +467,7 @@ def morning_briefing(request):
 
         def _run(uid, ckey):
             import django; django.setup()
-            import google.genai as _genai
             import yfinance as _yf
-            from django.conf import settings as _s
             from django.contrib.auth import get_user_model
             from django.core.cache import cache as _c
             from django.utils import timezone as tz
@@ -615,12 +637,9 @@ Top 3-5 จาก Momentum US + US SEPA
 Macro risks, Earnings, การเมือง หรือสัญญาณที่น่าเป็นห่วง
 """
 
-                client = _genai.Client(api_key=_s.GEMINI_API_KEY)
-                resp = client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=prompt,
-                )
-                report_text = resp.text or '## ไม่สามารถสร้างรายงานได้'
+                report_text = llm_generate(
+                    prompt, use_case='morning_briefing', model='gemini-2.5-flash', user=uid,
+                ) or '## ไม่สามารถสร้างรายงานได้'
 
                 # ── 10. Save to DB ──────────────────────────────
                 MB.objects.create(
@@ -766,7 +785,6 @@ def macro_economy(request):
         analysis_last_updated = _cached.last_updated
 
     if request.GET.get('analyze') == 'true' and data:
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
         model_name_to_use = 'gemini-2.5-flash'
 
         # ดึงผลสแกนล่าสุดมาประกอบการวิเคราะห์กลุ่มอุตสาหกรรมและกลยุทธ์หุ้นรายตัว
@@ -826,11 +844,7 @@ def macro_economy(request):
         """
 
         try:
-            response = client.models.generate_content(
-                model=model_name_to_use,
-                contents=prompt
-            )
-            analysis_text = response.text or ""
+            analysis_text = llm_generate(prompt, use_case='macro_analysis', model=model_name_to_use, user=request.user)
 
             # ลบ markdown block wrapper ถ้า AI ไม่ปฏิบัติตาม prompt
             # Strip any residual markdown blocks if AI disobeys
@@ -941,11 +955,10 @@ def precision_scan_ai_analysis(request):
     ).format(sd=scan_date, tp=total_passed, sec=sec_text, q=q_text, b=b_text)
 
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        if not response.text:
+        text = llm_generate(prompt, use_case='precision_scan', model="gemini-2.5-flash", user=request.user)
+        if not text:
             return JsonResponse({"error": "AI ไม่ตอบกลับ"}, status=500)
-        return JsonResponse({"status": "success", "analysis": response.text})
+        return JsonResponse({"status": "success", "analysis": text})
     except Exception as e:
         err = str(e)
         if "API_KEY_INVALID" in err:
@@ -1030,11 +1043,10 @@ def us_precision_scan_ai_analysis(request):
     ).format(sd=scan_date, tp=total_passed, sec=sec_text, q=q_text, b=b_text)
 
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        if not response.text:
+        text = llm_generate(prompt, use_case='precision_scan', model="gemini-2.5-flash", user=request.user)
+        if not text:
             return JsonResponse({"error": "AI did not respond"}, status=500)
-        return JsonResponse({"status": "success", "analysis": response.text})
+        return JsonResponse({"status": "success", "analysis": text})
     except Exception as e:
         err = str(e)
         if "API_KEY_INVALID" in err:
@@ -1303,9 +1315,7 @@ def ai_manual_scanner(request):
 def _run_ai_manual_scan_bg(user_id, cache_key, market, scan_run_time):
     from django.core.cache import cache
     from django.contrib.auth import get_user_model
-    from django.conf import settings
     import json
-    from google import genai
     from stocks.models import PrecisionScanCandidate, AIManualScanResult
 
     try:
@@ -1382,8 +1392,6 @@ def _run_ai_manual_scan_bg(user_id, cache_key, market, scan_run_time):
         from google.genai import types
         import concurrent.futures
 
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
-
         prompt = f"""คุณคือ AI Analyst ผู้เชี่ยวชาญระบบ SEPA (Minervini), CAN SLIM และ Turtle Breakout
 คัดเลือก 5-8 หุ้นที่ดีที่สุดจากตลาด {market} โดยประเมินการจัดสรรพอร์ตการลงทุน 3 ระยะ (สั้น SEPA, กลาง CAN SLIM, ยาว Turtle) ตามเกณฑ์ด้านล่าง แล้วตอบเป็น JSON
 
@@ -1404,9 +1412,11 @@ def _run_ai_manual_scan_bg(user_id, cache_key, market, scan_run_time):
 {{"status":"success","market":"{market}","selected_stocks":[{{"rank":1,"symbol":"X","grade":"A","reasoning":"ภาษาไทย 3-4 ประโยค วิเคราะห์เชิงกลยุทธ์ของตัวหุ้นให้สอดคล้องกับขอบเวลาและสัญญาณเทคนิคัล/พื้นฐาน"}}]}}"""
 
         def _call_gemini():
-            return client.models.generate_content(
+            return llm_generate(
+                prompt,
+                use_case='ai_manual_scan',
                 model='gemini-2.5-flash-lite',
-                contents=prompt,
+                user=user_id,
                 config=types.GenerateContentConfig(
                     response_mime_type='application/json',
                     temperature=0.0,
@@ -1427,7 +1437,7 @@ def _run_ai_manual_scan_bg(user_id, cache_key, market, scan_run_time):
                 }, timeout=300)
                 return
         
-        result_json = json.loads(response.text)
+        result_json = json.loads(response)
         
         if result_json.get('status') == 'success':
             # Step 4: Save results — delete AFTER new ones are ready (safe swap)
@@ -1631,7 +1641,6 @@ def investment_dashboard_refresh(request):
     """
     import json
 
-    import google.genai as genai
     from django.conf import settings
     from django.contrib import messages
     from django.db.models import Max
@@ -1890,9 +1899,7 @@ def investment_dashboard_refresh(request):
     try:
         api_key = getattr(settings, "GEMINI_API_KEY", None)
         if api_key:
-            client = genai.Client(api_key=api_key)
-            response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-            ai_strategy = response.text or ai_strategy
+            ai_strategy = llm_generate(prompt, use_case='investment_dashboard', model='gemini-2.5-flash', user=request.user) or ai_strategy
             _txt = ai_strategy.lower()
             if any(w in _txt for w in ["bullish", "ขาขึ้น", "รุก", "ซื้อ"]): market_outlook = "Bullish"
             elif any(w in _txt for w in ["bearish", "ขาลง", "ระวัง", "ขาย"]): market_outlook = "Bearish"
@@ -2132,9 +2139,7 @@ def trigger_daily_agent_report_ajax(request):
     
     def _run_bg(uid, slot, r_date, ckey):
         import django; django.setup()
-        import google.genai as _genai
         import yfinance as _yf
-        from django.conf import settings as _s
         from django.contrib.auth import get_user_model
         from django.core.cache import cache as _c
         from django.utils import timezone as tz
@@ -2278,12 +2283,9 @@ def trigger_daily_agent_report_ajax(request):
 - ห้ามวางหัวตารางกับ separator ไว้บรรทัดเดียวกัน
 """
 
-            client = _genai.Client(api_key=_s.GEMINI_API_KEY)
-            resp = client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=prompt,
-            )
-            report_text = resp.text or '## ไม่สามารถสร้างรายงานประจำรอบได้เนื่องจากข้อผิดพลาดของ AI'
+            report_text = llm_generate(
+                prompt, use_case='daily_agent_report', model='gemini-2.5-flash', user=uid,
+            ) or '## ไม่สามารถสร้างรายงานประจำรอบได้เนื่องจากข้อผิดพลาดของ AI'
 
             # บันทึกลงตาราง (และหลีกเลี่ยงการบันทึกซ้ำโดยใช้ get_or_create หรือ handle unique_together)
             DailyAgentReport.objects.update_or_create(
@@ -2345,27 +2347,8 @@ def stock_ai_advisor(request):
     return render(request, 'stocks/stock_ai_advisor.html', {})
 
 
-@login_required
-def api_stock_ai_advisor(request):
-    """AJAX endpoint: รับ symbol แล้วคืน analysis text จาก Gemini"""
-    from django.http import JsonResponse
-
-    symbol = (request.GET.get('symbol') or '').strip().upper()
-    if not symbol:
-        return JsonResponse({'error': 'กรุณาระบุชื่อหุ้น'}, status=400)
-
-    api_key = getattr(settings, "GEMINI_API_KEY", None)
-    if not api_key:
-        return JsonResponse({'error': 'ไม่พบ GEMINI_API_KEY'}, status=500)
-
-    stock = (PrecisionScanCandidate.objects
-             .filter(user=request.user, market='SET', symbol=symbol)
-             .order_by('-scan_run').first())
-    if not stock:
-        return JsonResponse({
-            'error': f'ไม่พบข้อมูล {symbol} ในผล Precision Scan ล่าสุด — กรุณารัน Precision Scan ก่อน',
-        }, status=404)
-
+def _stock_advisor_prompt(symbol, stock):
+    """prompt ของ AI Advisor — รวม backtest 3 ปีของทุก preset (ดึงราคาจาก yfinance ใช้เวลาหลายวินาที)"""
     # Backtest reference (best-effort — ไม่ให้ล้มทั้งหมดถ้าดึงราคาไม่สำเร็จ)
     backtest_text = "  (ไม่สามารถดึงข้อมูล backtest ได้)"
     try:
@@ -2392,12 +2375,14 @@ def api_stock_ai_advisor(request):
 
     vp_poc = getattr(stock, 'vp_poc_price', None)
     vp_status = getattr(stock, 'vp_status', '')
+    vp_vah = getattr(stock, 'vp_vah', None)
+    vp_val = getattr(stock, 'vp_val', None)
 
     signals = (
         "Stage 2 (ขาขึ้นยืนยัน): {stage2}\n"
         "SEPA (Stage2+RS>=70): {sepa} | RS Rating: {rs}\n"
         "VCP Setup: {vcp} | CAN SLIM: {canslim} | Pocket Pivot: {pp}\n"
-        "Volume Profile POC: {vp_poc} | VP Status: {vp_status}\n"
+        "Volume Profile POC: {vp_poc} | VP Status: {vp_status} | Value Area: {vp_val} - {vp_vah}\n"
         "CMF: {cmf} | RVOL: {rvol}x | Vol Surge: {volsurge}\n"
         "ACC Days: {acc} / DIST Days: {dist} (ใน 10 วันล่าสุด)\n"
         "Trend Template (Minervini 8 ข้อ): {tt}/8 (ผ่านครบ: {ttpass})\n"
@@ -2411,6 +2396,7 @@ def api_stock_ai_advisor(request):
         stage2=_yn(stock.stage2), sepa=_yn(stock.stage2 and (stock.rs_rating or 0) >= 70), rs=stock.rs_rating,
         vcp=_yn(getattr(stock, 'vcp_setup', False)), canslim=_yn(stock.is_canslim), pp=_yn(stock.pocket_pivot),
         vp_poc=vp_poc if vp_poc else "N/A", vp_status=vp_status if vp_status else "N/A",
+        vp_vah=vp_vah if vp_vah else "N/A", vp_val=vp_val if vp_val else "N/A",
         cmf=stock.cmf, rvol=stock.rvol, volsurge=_yn(stock.is_volume_surge),
         acc=stock.acc_days, dist=stock.dist_days,
         tt=stock.trend_template_score, ttpass=_yn(stock.trend_template_passed),
@@ -2453,16 +2439,50 @@ def api_stock_ai_advisor(request):
         "ห้ามใช้คำที่ฟังดูเป็นการรับประกันกำไร ให้ลงท้ายด้วยข้อความเตือนว่าผู้ใช้ควรพิจารณาความเสี่ยงและตั้ง Stop Loss เอง\n"
         "จัดรูปแบบ Markdown"
     )
+    return prompt
+
+
+def _advisor_candidate(request):
+    """Returns: (symbol, ผล Precision Scan ล่าสุด, None) หรือ (None, None, JsonResponse ข้อผิดพลาด)"""
+    from django.http import JsonResponse
+
+    symbol = (request.GET.get('symbol') or '').strip().upper()
+    if not symbol:
+        return None, None, JsonResponse({'error': 'กรุณาระบุชื่อหุ้น'}, status=400)
+
+    api_key = getattr(settings, "GEMINI_API_KEY", None)
+    if not api_key:
+        return None, None, JsonResponse({'error': 'ไม่พบ GEMINI_API_KEY'}, status=500)
+
+    stock = (PrecisionScanCandidate.objects
+             .filter(user=request.user, market='SET', symbol=symbol)
+             .order_by('-scan_run').first())
+    if not stock:
+        return None, None, JsonResponse({
+            'error': f'ไม่พบข้อมูล {symbol} ในผล Precision Scan ล่าสุด — กรุณารัน Precision Scan ก่อน',
+        }, status=404)
+    return symbol, stock, None
+
+
+@login_required
+def api_stock_ai_advisor(request):
+    """AJAX endpoint: รับ symbol แล้วคืน analysis text จาก Gemini"""
+    from django.http import JsonResponse
+
+    symbol, stock, error = _advisor_candidate(request)
+    if error is not None:
+        return error
+
+    prompt = _stock_advisor_prompt(symbol, stock)
 
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(model="gemini-2.5-flash", contents=prompt)
-        if not response.text:
+        text = llm_generate(prompt, use_case='stock_advisor', model="gemini-2.5-flash", user=request.user)
+        if not text:
             return JsonResponse({'error': 'AI ไม่ตอบกลับ'}, status=500)
         return JsonResponse({
             'status': 'success',
             'symbol': symbol,
-            'analysis': response.text,
+            'analysis': text,
             'scan_run': stock.scan_run.strftime('%d/%m/%Y %H:%M'),
         })
     except Exception as e:
@@ -2472,3 +2492,30 @@ def api_stock_ai_advisor(request):
         return JsonResponse({'error': f'Gemini error: {err}'}, status=500)
 
 
+@login_required
+def api_stock_ai_advisor_stream(request):
+    """api_stock_ai_advisor แบบ SSE — ตอบทันที แล้วทยอยส่งข้อความจาก AI ; บันทึกผลลง AnalysisCache (ADVISOR_<symbol>)"""
+    from utils.llm_stream import sse_response, stream_llm
+
+    symbol, stock, error = _advisor_candidate(request)
+    if error is not None:
+        return error
+
+    user = request.user
+    scan_run = stock.scan_run.strftime('%d/%m/%Y %H:%M')
+
+    def persist(text):
+        AnalysisCache.objects.update_or_create(
+            user=user, symbol=f'ADVISOR_{symbol}'[:20], defaults={'analysis_data': text},
+        )
+
+    def events():
+        yield 'status', {'message': 'กำลังดึง backtest ย้อนหลัง 3 ปี...', 'symbol': symbol, 'scan_run': scan_run}
+        prompt = _stock_advisor_prompt(symbol, stock)
+        yield 'status', {'message': 'AI กำลังวิเคราะห์...'}
+        yield from stream_llm(prompt, 'stock_advisor', 'gemini-2.5-flash', user=user, persist=persist,
+                              extra={'symbol': symbol, 'scan_run': scan_run})
+
+    return sse_response(events)
+
+
@@ -8,7 +8,7 @@ from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 from django.views.decorators.http import require_POST
 
-from stocks.alert_engine import evaluate_user_alerts
+from stocks.alert_engine import evaluate_user_alerts, refresh_unread_alert_state
 from stocks.forms import StockAlertConfigForm
 from stocks.models import StockAlertConfig, StockAlertEvent
 
@@ -57,6 +57,7 @@ def stock_alert_config_view(request):
         form = StockAlertConfigForm(request.POST, instance=config)
         if form.is_valid():
             form.save()
+            refresh_unread_alert_state(request.user)
             messages.success(request, 'บันทึกการตั้งค่าแจ้งเตือนเรียบร้อยแล้ว')
             return redirect('stocks:stock_alert_config')
     else:
@@ -99,6 +100,7 @@ def stock_alert_history(request):
 def mark_stock_alerts_read(request):
     """ทำเครื่องหมายอ่านแล้วทั้งหมด ผ่าน AJAX"""
     StockAlertEvent.objects.filter(user=request.user, is_read=False).update(is_read=True)
+    refresh_unread_alert_state(request.user)
     return JsonResponse({'success': True, 'unread_count': 0})
 
 
@@ -109,5 +111,5 @@ def mark_stock_alert_read(request, pk):
     event = get_object_or_404(StockAlertEvent, pk=pk, user=request.user)
     event.is_read = not event.is_read
     event.save(update_fields=['is_read'])
-    unread_count = StockAlertEvent.objects.filter(user=request.user, is_read=False).count()
+    unread_count = refresh_unread_alert_state(request.user)['count']
     return JsonResponse({'success': True, 'is_read': event.is_read, 'unread_count': unread_count})
@@ -58,6 +58,7 @@ from stocks.utils import (
     get_stock_data,
     refresh_all_thai_symbols,
 )
+from utils.llm_gateway import generate as llm_generate
 
 # Removed custom session for yfinance to let it handle curl_cffi internally
 
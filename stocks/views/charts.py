@@ -15,81 +15,64 @@ def stock_chart(request, symbol):
     }
     return render(request, 'stocks/stock_chart.html', context)
 
-@login_required
-def chart_ai_analyze_ajax(request, symbol):
-    import json
-    from django.http import JsonResponse
-    from django.conf import settings
-    from google import genai
-    from django.views.decorators.csrf import csrf_exempt
-    from django.utils import timezone
-    from stocks.models import AnalysisCache, PrecisionScanCandidate, USSepaCandidate
 
-    if request.method != 'POST':
-        return JsonResponse({'error': 'Invalid request method'}, status=400)
+def _chart_ai_prompt(user, symbol, data):
+    """prompt วิเคราะห์กราฟหุ้น — ดึง SEPA / ปัจจัยพื้นฐาน / Volume Profile (yfinance) ประกอบ ใช้เวลาหลายวินาที"""
+    from stocks.models import PrecisionScanCandidate, USSepaCandidate
 
-    try:
-        data = json.loads(request.body)
-        market = data.get('market', '')
-        price = data.get('price', 'N/A')
-        trend = data.get('trend', 'N/A')
-        signals = data.get('signals', [])
-        force_refresh = data.get('force_refresh', False)
-        active_indicators_data = data.get('active_indicators_data', 'ไม่มีข้อมูล (ผู้ใช้ปิด Indicator ทั้งหมด)')
-        
-        # Check cache if not forcing refresh
-        if not force_refresh:
-            cache_entry = AnalysisCache.objects.filter(user=request.user, symbol=symbol).first()
-            if cache_entry and cache_entry.last_updated.date() == timezone.now().date():
-                return JsonResponse({'result': cache_entry.analysis_data, 'cached': True})
+    market = data.get('market', '')
+    price = data.get('price', 'N/A')
+    trend = data.get('trend', 'N/A')
+    signals = data.get('signals', [])
+    active_indicators_data = data.get('active_indicators_data', 'ไม่มีข้อมูล (ผู้ใช้ปิด Indicator ทั้งหมด)')
 
-        signal_text = ", ".join([s.get('type', '') for s in signals]) if signals else "ไม่มีสัญญาณซื้อขายล่าสุด"
+    signal_text = ", ".join([s.get('type', '') for s in signals]) if signals else "ไม่มีสัญญาณซื้อขายล่าสุด"
 
-        # ====== Fetch SEPA Data ======
-        sepa_info = ""
-        try:
-            if market == 'US':
-                sepa_cand = USSepaCandidate.objects.filter(user=request.user, symbol=symbol).order_by('-scan_run').first()
-            else:
-                sepa_cand = PrecisionScanCandidate.objects.filter(user=request.user, symbol=symbol, market='SET').order_by('-scan_run').first()
-                
-            if sepa_cand:
-                eps_g = getattr(sepa_cand, 'eps_growth', 0.0) or 0.0
-                rev_g = getattr(sepa_cand, 'rev_growth', 0.0) or 0.0
-                rs_rt = getattr(sepa_cand, 'rs_rating', 0) or 0
-                vcp   = getattr(sepa_cand, 'vcp_setup', False)
-                stg2  = getattr(sepa_cand, 'stage2', False)
-                adx_v = getattr(sepa_cand, 'adx', 0) or 0
-                dist  = getattr(sepa_cand, 'upside_to_high', 0.0) or 0.0
-                pp    = getattr(sepa_cand, 'pocket_pivot', False)
-
-                # Calculate roughly SEPA Score as in minervini_sepa_scanner
-                sc = 0
-                if vcp:
-                    sc += 30
-                    sc += int(max(0, (10 - min(getattr(sepa_cand, 'vcp_tightness', 0) or 0, 10)) * 2))
-                    sc += min(getattr(sepa_cand, 'vcp_contractions', 0) or 0, 5) * 3
-                if getattr(sepa_cand, 'vcp_vdu', False) or getattr(sepa_cand, 'vdu_near_zone', False):
-                    sc += 20
-                if pp:
-                    sc += 10
-                sc += int(rs_rt * 0.7)
-                if adx_v >= 25: sc += 10
-                elif adx_v >= 15: sc += 5
-                
-                if vcp:
-                    if dist <= 5: sc += 10
-                    elif dist <= 10: sc += 5
-                    elif dist > 15: sc -= 5
-                        
-                if eps_g >= 50: sc += 20
-                elif eps_g >= 25: sc += 12
-                elif eps_g >= 10: sc += 5
-                
-                if rev_g >= 50: sc += 10
-                elif rev_g >= 25: sc += 6
-                
-                sepa_info = f"""
+    # ====== Fetch SEPA Data ======
+    sepa_info = ""
+    try:
+        if market == 'US':
+            sepa_cand = USSepaCandidate.objects.filter(user=user, symbol=symbol).order_by('-scan_run').first()
+        else:
+            sepa_cand = PrecisionScanCandidate.objects.filter(user=user, symbol=symbol, market='SET').order_by('-scan_run').first()
+            
+        if sepa_cand:
+            eps_g = getattr(sepa_cand, 'eps_growth', 0.0) or 0.0
+            rev_g = getattr(sepa_cand, 'rev_growth', 0.0) or 0.0
+            rs_rt = getattr(sepa_cand, 'rs_rating', 0) or 0
+            vcp   = getattr(sepa_cand, 'vcp_setup', False)
+            stg2  = getattr(sepa_cand, 'stage2', False)
+            adx_v = getattr(sepa_cand, 'adx', 0) or 0
+            dist  = getattr(sepa_cand, 'upside_to_high', 0.0) or 0.0
+            pp    = getattr(sepa_cand, 'pocket_pivot', False)
+
+            # Calculate roughly SEPA Score as in minervini_sepa_scanner
+            sc = 0
+            if vcp:
+                sc += 30
+                sc += int(max(0, (10 - min(getattr(sepa_cand, 'vcp_tightness', 0) or 0, 10)) * 2))
+                sc += min(getattr(sepa_cand, 'vcp_contractions', 0) or 0, 5) * 3
+            if getattr(sepa_cand, 'vcp_vdu', False) or getattr(sepa_cand, 'vdu_near_zone', False):
+                sc += 20
+            if pp:
+                sc += 10
+            sc += int(rs_rt * 0.7)
+            if adx_v >= 25: sc += 10
+            elif adx_v >= 15: sc += 5
+            
+            if vcp:
+                if dist <= 5: sc += 10
+                elif dist <= 10: sc += 5
+                elif dist > 15: sc -= 5
+                    
+            if eps_g >= 50: sc += 20
+            elif eps_g >= 25: sc += 12
+            elif eps_g >= 10: sc += 5
+            
+            if rev_g >= 50: sc += 10
+            elif rev_g >= 25: sc += 6
+            
+            sepa_info = f"""
 ข้อมูล SEPA Scanner (Minervini) ปัจจุบัน:
 - Stage 2 Trend (M - Market Direction): {'Yes' if stg2 else 'No'}
 - VCP Setup (Volatility Contraction Pattern): {'Yes' if vcp else 'No'}
@@ -98,64 +81,64 @@ def chart_ai_analyze_ajax(request, symbol):
 - EPS Growth (C - Current Earnings): {eps_g}% / Rev Growth: {rev_g}%
 - SEPA Score: {sc}
 """
-        except Exception as e:
-            sepa_info = f"<!-- SEPA Fetch Error: {e} -->"
+    except Exception as e:
+        sepa_info = f"<!-- SEPA Fetch Error: {e} -->"
 
-        # ====== Fetch Fundamental & Business Data ======
-        fundamentals_info = ""
-        volume_profile_info = ""
-        price_pattern_info = ""
-        try:
-            import yfinance as yf
-            import numpy as np
-            yf_symbol = '^SET.BK' if symbol == 'SET' else (symbol if symbol.endswith('.BK') or market != 'SET' else symbol + '.BK')
-            ticker = yf.Ticker(yf_symbol)
-            info = ticker.info
-            
-            biz_summary = info.get('longBusinessSummary', 'ไม่มีข้อมูลคำอธิบายธุรกิจ')
-            sector = info.get('sector', 'N/A')
-            industry = info.get('industry', 'N/A')
-            
-            roe = info.get('returnOnEquity', None)
-            roe_str = f"{roe * 100:.2f}%" if roe is not None else "N/A"
-            
-            roa = info.get('returnOnAssets', None)
-            roa_str = f"{roa * 100:.2f}%" if roa is not None else "N/A"
-            
-            pe = info.get('trailingPE', 'N/A')
-            pb = info.get('priceToBook', 'N/A')
-            
-            div_yield = info.get('dividendYield', None)
-            div_str = "N/A"
-            if div_yield is not None:
-                try:
-                    val = float(div_yield)
-                    if val > 100.0:
-                        val = val / 100.0
-                    elif val < 1.0:
-                        val = val * 100.0
-                    div_str = f"{val:.2f}%"
-                except Exception:
-                    div_str = f"{div_yield}"
-            
-            rev_latest = "N/A"
-            net_income_latest = "N/A"
+    # ====== Fetch Fundamental & Business Data ======
+    fundamentals_info = ""
+    volume_profile_info = ""
+    price_pattern_info = ""
+    try:
+        import yfinance as yf
+        import numpy as np
+        yf_symbol = '^SET.BK' if symbol == 'SET' else (symbol if symbol.endswith('.BK') or market != 'SET' else symbol + '.BK')
+        ticker = yf.Ticker(yf_symbol)
+        info = ticker.info
+        
+        biz_summary = info.get('longBusinessSummary', 'ไม่มีข้อมูลคำอธิบายธุรกิจ')
+        sector = info.get('sector', 'N/A')
+        industry = info.get('industry', 'N/A')
+        
+        roe = info.get('returnOnEquity', None)
+        roe_str = f"{roe * 100:.2f}%" if roe is not None else "N/A"
+        
+        roa = info.get('returnOnAssets', None)
+        roa_str = f"{roa * 100:.2f}%" if roa is not None else "N/A"
+        
+        pe = info.get('trailingPE', 'N/A')
+        pb = info.get('priceToBook', 'N/A')
+        
+        div_yield = info.get('dividendYield', None)
+        div_str = "N/A"
+        if div_yield is not None:
             try:
-                financials = ticker.financials
-                if financials is not None and not financials.empty:
-                    rev_row = [r for r in financials.index if 'Revenue' in r or 'Total Revenue' in r]
-                    if rev_row:
-                        val = financials.loc[rev_row[0]].iloc[0]
-                        rev_latest = f"{val:,.2f}" if not isinstance(val, str) else val
-                    
-                    net_inc_row = [r for r in financials.index if 'Net Income' in r]
-                    if net_inc_row:
-                        val = financials.loc[net_inc_row[0]].iloc[0]
-                        net_income_latest = f"{val:,.2f}" if not isinstance(val, str) else val
+                val = float(div_yield)
+                if val > 100.0:
+                    val = val / 100.0
+                elif val < 1.0:
+                    val = val * 100.0
+                div_str = f"{val:.2f}%"
             except Exception:
-                pass
+                div_str = f"{div_yield}"
+        
+        rev_latest = "N/A"
+        net_income_latest = "N/A"
+        try:
+            financials = ticker.financials
+            if financials is not None and not financials.empty:
+                rev_row = [r for r in financials.index if 'Revenue' in r or 'Total Revenue' in r]
+                if rev_row:
+                    val = financials.loc[rev_row[0]].iloc[0]
+                    rev_latest = f"{val:,.2f}" if not isinstance(val, str) else val
                 
-            fundamentals_info = f"""
+                net_inc_row = [r for r in financials.index if 'Net Income' in r]
+                if net_inc_row:
+                    val = financials.loc[net_inc_row[0]].iloc[0]
+                    net_income_latest = f"{val:,.2f}" if not isinstance(val, str) else val
+        except Exception:
+            pass
+            
+        fundamentals_info = f"""
 ข้อมูลปัจจัยพื้นฐาน (Fundamental Data) จาก yfinance:
 - กลุ่มอุตสาหกรรม/หมวดธุรกิจ: {sector} / {industry}
 - คำอธิบายธุรกิจหลัก: {biz_summary}
@@ -165,126 +148,126 @@ def chart_ai_analyze_ajax(request, symbol):
 - อัตราปันผล (Dividend Yield): {div_str}
 - ผลประกอบการล่าสุด: รายได้รวม ~ {rev_latest} | กำไรสุทธิ ~ {net_income_latest}
 """
-            
-            # --- Calculate Volume Profile & Price Patterns ---
-            try:
-                df = ticker.history(period="1y", interval="1d")
-                if df is not None and not df.empty:
-                    # Resolve MultiIndex if any
-                    if isinstance(df.columns, np.ndarray) or isinstance(df.columns, list) or hasattr(df.columns, 'levels'):
-                        if hasattr(df.columns, 'get_level_values'):
-                            df.columns = df.columns.get_level_values(0)
-                    df.columns = [str(c).capitalize() for c in df.columns]
-                    df = df.dropna(subset=['Close', 'Volume'])
+        
+        # --- Calculate Volume Profile & Price Patterns ---
+        try:
+            df = ticker.history(period="1y", interval="1d")
+            if df is not None and not df.empty:
+                # Resolve MultiIndex if any
+                if isinstance(df.columns, np.ndarray) or isinstance(df.columns, list) or hasattr(df.columns, 'levels'):
+                    if hasattr(df.columns, 'get_level_values'):
+                        df.columns = df.columns.get_level_values(0)
+                df.columns = [str(c).capitalize() for c in df.columns]
+                df = df.dropna(subset=['Close', 'Volume'])
+                
+                if len(df) >= 30:
+                    hist_len = min(len(df), 120)
+                    sub_df = df.tail(hist_len)
+                    closes = sub_df['Close'].values
+                    volumes = sub_df['Volume'].values
                     
-                    if len(df) >= 30:
-                        hist_len = min(len(df), 120)
-                        sub_df = df.tail(hist_len)
-                        closes = sub_df['Close'].values
-                        volumes = sub_df['Volume'].values
-                        
-                        min_p = float(closes.min())
-                        max_p = float(closes.max())
-                        
-                        # Calculate POC, VAH, VAL
-                        bins = np.linspace(min_p, max_p, 11)
-                        bin_vols = np.zeros(10)
-                        for i in range(10):
-                            mask = (closes >= bins[i]) & (closes < bins[i+1])
-                            bin_vols[i] = volumes[mask].sum()
-                        mask_max = (closes == max_p)
-                        if mask_max.any() and len(bin_vols) > 0:
-                            bin_vols[-1] += volumes[mask_max].sum()
-                            
-                        max_vol_idx = int(np.argmax(bin_vols))
-                        poc_price = (bins[max_vol_idx] + bins[max_vol_idx+1]) / 2.0
+                    min_p = float(closes.min())
+                    max_p = float(closes.max())
+                    
+                    # Calculate POC, VAH, VAL
+                    bins = np.linspace(min_p, max_p, 11)
+                    bin_vols = np.zeros(10)
+                    for i in range(10):
+                        mask = (closes >= bins[i]) & (closes < bins[i+1])
+                        bin_vols[i] = volumes[mask].sum()
+                    mask_max = (closes == max_p)
+                    if mask_max.any() and len(bin_vols) > 0:
+                        bin_vols[-1] += volumes[mask_max].sum()
                         
-                        total_volume = bin_vols.sum()
-                        target_va_vol = total_volume * 0.70
-                        va_indices = {max_vol_idx}
-                        current_va_vol = bin_vols[max_vol_idx]
+                    max_vol_idx = int(np.argmax(bin_vols))
+                    poc_price = (bins[max_vol_idx] + bins[max_vol_idx+1]) / 2.0
+                    
+                    total_volume = bin_vols.sum()
+                    target_va_vol = total_volume * 0.70
+                    va_indices = {max_vol_idx}
+                    current_va_vol = bin_vols[max_vol_idx]
+                    
+                    while current_va_vol < target_va_vol and len(va_indices) < 10:
+                        next_left = min(va_indices) - 1
+                        next_right = max(va_indices) + 1
+                        left_vol = bin_vols[next_left] if next_left >= 0 else -1
+                        right_vol = bin_vols[next_right] if next_right < 10 else -1
                         
-                        while current_va_vol < target_va_vol and len(va_indices) < 10:
-                            next_left = min(va_indices) - 1
-                            next_right = max(va_indices) + 1
-                            left_vol = bin_vols[next_left] if next_left >= 0 else -1
-                            right_vol = bin_vols[next_right] if next_right < 10 else -1
+                        if left_vol > right_vol:
+                            va_indices.add(next_left)
+                            current_va_vol += left_vol
+                        elif right_vol >= 0:
+                            va_indices.add(next_right)
+                            current_va_vol += right_vol
+                        else:
+                            break
                             
-                            if left_vol > right_vol:
-                                va_indices.add(next_left)
-                                current_va_vol += left_vol
-                            elif right_vol >= 0:
-                                va_indices.add(next_right)
-                                current_va_vol += right_vol
-                            else:
-                                break
-                                
-                        vah_price = bins[max(va_indices) + 1]
-                        val_price = bins[min(va_indices)]
-                        
-                        volume_profile_info = f"""
+                    vah_price = bins[max(va_indices) + 1]
+                    val_price = bins[min(va_indices)]
+                    
+                    volume_profile_info = f"""
 ข้อมูล Volume Profile (ย้อนหลัง {hist_len} วันทำการ):
 - Point of Control (POC): {poc_price:.2f} (ระดับราคาที่มีปริมาณการซื้อขายหนาแน่นสะสมมากที่สุด)
 - Value Area High (VAH): {vah_price:.2f}
 - Value Area Low (VAL): {val_price:.2f}
 """
 
-                        # Price Patterns
-                        detected_patterns = []
+                    # Price Patterns
+                    detected_patterns = []
+                    
+                    # 1. VCP Detection
+                    if len(df) >= 60:
+                        p3 = df['Close'].tail(20)
+                        p2 = df['Close'].iloc[-40:-20]
+                        p1 = df['Close'].iloc[-60:-40]
                         
-                        # 1. VCP Detection
-                        if len(df) >= 60:
-                            p3 = df['Close'].tail(20)
-                            p2 = df['Close'].iloc[-40:-20]
-                            p1 = df['Close'].iloc[-60:-40]
-                            
-                            rng3 = (p3.max() - p3.min()) / p3.mean()
-                            rng2 = (p2.max() - p2.min()) / p2.mean()
-                            rng1 = (p1.max() - p1.min()) / p1.mean()
-                            
-                            if rng1 > rng2 > rng3 and rng3 < 0.10:
-                                detected_patterns.append("Volatility Contraction Pattern (VCP) - ตรวจพบรูปแบบการบีบอัดของความผันผวนของราคา (Contractions)")
-                                
-                        # 2. Double Bottom Detection
-                        if len(df) >= 40:
-                            mins = []
-                            for idx in range(5, len(closes)-5):
-                                if closes[idx] == min(closes[idx-5:idx+6]):
-                                    mins.append((idx, closes[idx]))
+                        rng3 = (p3.max() - p3.min()) / p3.mean()
+                        rng2 = (p2.max() - p2.min()) / p2.mean()
+                        rng1 = (p1.max() - p1.min()) / p1.mean()
+                        
+                        if rng1 > rng2 > rng3 and rng3 < 0.10:
+                            detected_patterns.append("Volatility Contraction Pattern (VCP) - ตรวจพบรูปแบบการบีบอัดของความผันผวนของราคา (Contractions)")
                             
-                            db_found = False
-                            support_level = 0.0
-                            for i in range(len(mins)):
-                                for j in range(i+1, len(mins)):
-                                    idx1, val1 = mins[i]
-                                    idx2, val2 = mins[j]
-                                    if abs(idx1 - idx2) >= 10 and abs(val1 - val2) / val1 <= 0.03:
-                                        db_found = True
-                                        support_level = (val1 + val2) / 2.0
-                                        break
-                                if db_found:
+                    # 2. Double Bottom Detection
+                    if len(df) >= 40:
+                        mins = []
+                        for idx in range(5, len(closes)-5):
+                            if closes[idx] == min(closes[idx-5:idx+6]):
+                                mins.append((idx, closes[idx]))
+                        
+                        db_found = False
+                        support_level = 0.0
+                        for i in range(len(mins)):
+                            for j in range(i+1, len(mins)):
+                                idx1, val1 = mins[i]
+                                idx2, val2 = mins[j]
+                                if abs(idx1 - idx2) >= 10 and abs(val1 - val2) / val1 <= 0.03:
+                                    db_found = True
+                                    support_level = (val1 + val2) / 2.0
                                     break
-                                    
                             if db_found:
-                                detected_patterns.append(f"Double Bottom / Support Zone - ตรวจพบแนวรับสำคัญแบบคู่ฐาน (Double Bottom / Support Zone) แถวๆ ระดับราคา {support_level:.2f}")
+                                break
                                 
-                        recent_max = float(df['High'].tail(20).max())
-                        if float(closes[-1]) >= recent_max * 0.98:
-                            detected_patterns.append("ราคาเคลื่อนไหวใกล้ระดับสูงสุดของรอบ 20 วัน (20-day High Breakout Setup)")
-                        elif float(closes[-1]) <= float(df['Low'].tail(20).min()) * 1.02:
-                            detected_patterns.append("ราคาลงมาเคลี่อนไหวใกล้ระดับต่ำสุดของรอบ 20 วัน (20-day Low Breakdown Risk)")
-
-                        if not detected_patterns:
-                            detected_patterns.append("ไม่พบรูปแบบราคา Pattern เด่นชัดในระยะสั้น (ราคากำลังสร้างฐานสะสมกำลัง)")
+                        if db_found:
+                            detected_patterns.append(f"Double Bottom / Support Zone - ตรวจพบแนวรับสำคัญแบบคู่ฐาน (Double Bottom / Support Zone) แถวๆ ระดับราคา {support_level:.2f}")
                             
-                        price_pattern_info = "รูปแบบราคาที่ตรวจพบ (Price Pattern Detection):\n" + "\n".join([f"- {pat}" for pat in detected_patterns])
-            except Exception as e_calc:
-                volume_profile_info = f"<!-- Volume Profile Calc Error: {e_calc} -->"
+                    recent_max = float(df['High'].tail(20).max())
+                    if float(closes[-1]) >= recent_max * 0.98:
+                        detected_patterns.append("ราคาเคลื่อนไหวใกล้ระดับสูงสุดของรอบ 20 วัน (20-day High Breakout Setup)")
+                    elif float(closes[-1]) <= float(df['Low'].tail(20).min()) * 1.02:
+                        detected_patterns.append("ราคาลงมาเคลี่อนไหวใกล้ระดับต่ำสุดของรอบ 20 วัน (20-day Low Breakdown Risk)")
+
+                    if not detected_patterns:
+                        detected_patterns.append("ไม่พบรูปแบบราคา Pattern เด่นชัดในระยะสั้น (ราคากำลังสร้างฐานสะสมกำลัง)")
+                        
+                    price_pattern_info = "รูปแบบราคาที่ตรวจพบ (Price Pattern Detection):\n" + "\n".join([f"- {pat}" for pat in detected_patterns])
+        except Exception as e_calc:
+            volume_profile_info = f"<!-- Volume Profile Calc Error: {e_calc} -->"
 
-        except Exception as e:
-            fundamentals_info = f"<!-- Fundamentals Fetch Error: {e} -->"
+    except Exception as e:
+        fundamentals_info = f"<!-- Fundamentals Fetch Error: {e} -->"
 
-        prompt = f"""
+    prompt = f"""
 คุณคือ AI ผู้ช่วยนักวิเคราะห์หุ้นระดับสากลและผู้เชี่ยวชาญด้านกลยุทธ์การลงทุน (ทั้งด้าน Technical, Quantitative และ Fundamental)
 โปรดทำการวิเคราะห์เชิงลึกเกี่ยวกับหุ้น {symbol} (ตลาด: {market}) โดยสรุปเป็นภาษาไทยให้สวยงาม กระชับ ครอบคลุมหัวข้อต่อไปนี้:
 
@@ -309,28 +292,54 @@ def chart_ai_analyze_ajax(request, symbol):
 
 จัดรูปแบบผลลัพธ์ด้วย Markdown ที่อ่านง่าย สวยงาม น่าเชื่อถือ และจำกัดความยาวของเนื้อหาแต่ละส่วนให้สั้นกระชับเข้าใจง่าย
 """
+    return prompt
+
+
+def _save_chart_analysis(user, symbol, text):
+    from stocks.models import AnalysisCache
+
+    AnalysisCache.objects.update_or_create(user=user, symbol=symbol, defaults={'analysis_data': text})
+
+
+def _cached_chart_analysis(user, symbol):
+    """ผลวิเคราะห์ของวันนี้ (ถ้ามี)"""
+    from django.utils import timezone
+    from stocks.models import AnalysisCache
+
+    cache_entry = AnalysisCache.objects.filter(user=user, symbol=symbol).first()
+    if cache_entry and cache_entry.last_updated.date() == timezone.now().date():
+        return cache_entry.analysis_data
+    return None
+
+
+@login_required
+def chart_ai_analyze_ajax(request, symbol):
+    import json
+    from django.http import JsonResponse
+    from django.conf import settings
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+        force_refresh = data.get('force_refresh', False)
+
+        # Check cache if not forcing refresh
+        if not force_refresh:
+            cached = _cached_chart_analysis(request.user, symbol)
+            if cached is not None:
+                return JsonResponse({'result': cached, 'cached': True})
 
         api_key = getattr(settings, "GEMINI_API_KEY", None)
         if not api_key:
             return JsonResponse({'error': 'No GEMINI_API_KEY configured'}, status=500)
 
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt
+        prompt = _chart_ai_prompt(request.user, symbol, data)
+        analysis_result = llm_generate(
+            prompt, use_case='chart_analysis', model='gemini-2.5-flash', user=request.user, refresh=bool(force_refresh),
         )
-
-        analysis_result = response.text
-        
-        # Save to Cache
-        cache_entry, created = AnalysisCache.objects.get_or_create(
-            user=request.user,
-            symbol=symbol,
-            defaults={'analysis_data': analysis_result}
-        )
-        if not created:
-            cache_entry.analysis_data = analysis_result
-            cache_entry.save()
+        _save_chart_analysis(request.user, symbol, analysis_result)
 
         return JsonResponse({'result': analysis_result, 'cached': False})
 
@@ -338,6 +347,45 @@ def chart_ai_analyze_ajax(request, symbol):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@login_required
+def chart_ai_analyze_stream(request, symbol):
+    """
+    chart_ai_analyze_ajax แบบ SSE — body เดียวกัน (POST JSON)
+    ตอบทันที แล้วทยอยส่ง status (กำลังดึงข้อมูล) → chunk (ข้อความจาก AI) → done ; บันทึกผลลง AnalysisCache ตอนจบ
+    """
+    import json
+    from django.http import JsonResponse
+    from django.conf import settings
+    from utils.llm_stream import sse_response, stream_llm
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=400)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not getattr(settings, "GEMINI_API_KEY", None):
+        return JsonResponse({'error': 'No GEMINI_API_KEY configured'}, status=500)
+
+    user = request.user
+    force_refresh = bool(data.get('force_refresh', False))
+
+    def events():
+        if not force_refresh:
+            cached = _cached_chart_analysis(user, symbol)
+            if cached is not None:
+                yield 'done', {'text': cached, 'cached': True}
+                return
+        yield 'status', {'message': 'กำลังรวบรวมข้อมูลพื้นฐาน / Volume Profile...'}
+        prompt = _chart_ai_prompt(user, symbol, data)
+        yield 'status', {'message': 'AI กำลังวิเคราะห์...'}
+        yield from stream_llm(
+            prompt, 'chart_analysis', 'gemini-2.5-flash', user=user, refresh=force_refresh,
+            persist=lambda text: _save_chart_analysis(user, symbol, text), extra={'cached': False},
+        )
+
+    return sse_response(events)
+
 
 @login_required
 def stock_chart_data(request, symbol):
@@ -400,8 +448,15 @@ def stock_chart_data(request, symbol):
             return default
 
     try:
-        df = _yf.download(yf_symbol, period=download_period, interval=download_interval,
-                          auto_adjust=True, progress=False, group_by='column')
+        if download_interval == '1d':
+            # กราฟรายวันอ่านจากคลังแท่งราคากลาง (ชุดเดียวกับที่ scanner ใช้)
+            from datetime import date as _date, timedelta as _td
+            from stocks.bar_store import get_symbol_bars
+            _days = 730 if download_period == '2y' else 365
+            df = get_symbol_bars(yf_symbol, start=_date.today() - _td(days=_days)).copy()
+        else:
+            df = _yf.download(yf_symbol, period=download_period, interval=download_interval,
+                              auto_adjust=True, progress=False, group_by='column')
         
         if df is None or df.empty:
             return _JR({'error': f'ไม่พบข้อมูลสำหรับ {yf_symbol} (yfinance returned empty)'}, status=404)
@@ -391,7 +391,8 @@ def analyze(request, symbol):
         if not analysis_text:
             # ส่งข้อมูลให้ AI วิเคราะห์และรับผลเป็น Markdown (เฉพาะกรณีไม่มีแคชหรือแคชเก่า)
             analysis_text = analyze_with_ai(symbol, data, extra_context=extra_ctx,
-                                            macro_signal=macro_signal, mr_context=mr_context)
+                                            macro_signal=macro_signal, mr_context=mr_context,
+                                            user=request.user)
 
         # ====== เตรียมข้อมูลกราฟราคาและวอลลุ่ม ======
         # Prepare Chart Data (Price & Volume)
@@ -36,6 +36,21 @@ def portfolio_list(request):
     logger.debug("Portfolio Scan Started for %s", getattr(request.user, "username", "Anonymous"))
     _portfolio_us_set = _build_us_symbol_set(request.user)
 
+    # ====== ดึงแท่งราคา 1 ปีของทุกตัวในพอร์ตครั้งเดียวจากคลังกลาง ======
+    def _fetch_symbol_of(item):
+        if item.market == MarketType.SET and not item.symbol.endswith('.BK'):
+            return f"{item.symbol}.BK"
+        if item.market == MarketType.CRYPTO and '-' not in item.symbol:
+            return f"{item.symbol}-USD"
+        return item.symbol
+
+    from stocks.bar_store import get_bars, get_symbol_bars
+    try:
+        _bars = get_bars(list({_fetch_symbol_of(i) for i in portfolio_items}))
+    except Exception as e:
+        logger.warning("Portfolio bar prefetch failed: %s", e)
+        _bars = {}
+
     for item in portfolio_items:
         try:
             symbol = item.symbol
@@ -43,22 +58,15 @@ def portfolio_list(request):
 
             # ====== ดึงข้อมูลราคาจาก yfinance ======
             # Determine correct symbol string for yfinance based on database market field
-            fetch_symbol = symbol
-            if item.market == MarketType.SET and not symbol.endswith('.BK'):
-                fetch_symbol = f"{symbol}.BK"
-            elif item.market == MarketType.CRYPTO and '-' not in symbol:
-                fetch_symbol = f"{symbol}-USD"
-            
-            t = yf.Ticker(fetch_symbol)
-            hist = t.history(period="1y")
+            fetch_symbol = _fetch_symbol_of(item)
+            hist = _bars[fetch_symbol].copy() if fetch_symbol in _bars else pd.DataFrame()
 
             # Fallback if empty (for robustness with manually entered symbols)
             used_symbol = fetch_symbol
             if hist.empty and fetch_symbol == symbol:
                 alt_sym = f"{symbol}.BK" if ".BK" not in symbol else symbol.replace(".BK", "")
                 logger.debug("Symbol %s empty, trying %s", symbol, alt_sym)
-                t = yf.Ticker(alt_sym)
-                hist = t.history(period="1y")
+                hist = get_symbol_bars(alt_sym).copy()
                 if not hist.empty:
                     used_symbol = alt_sym
 
@@ -66,18 +74,13 @@ def portfolio_list(request):
             rsi_val = None
 
             if not hist.empty:
-                # จัดการ MultiIndex columns ที่อาจเกิดขึ้นเมื่อ yfinance ส่งข้อมูลหลาย ticker
-                if isinstance(hist.columns, pd.MultiIndex):
-                    hist.columns = [col[0] for col in hist.columns]
-                hist = hist.loc[:, ~hist.columns.duplicated()]
-
                 current_price = float(hist['Close'].iloc[-1])
 
                 # ตรวจสอบซ้ำอีกรอบเพื่อกรณีที่ Close เป็น NaN
                 # Double check price
                 if not current_price or pd.isna(current_price):
                     try:
-                        info = t.info
+                        info = yf.Ticker(used_symbol).info
                         if isinstance(info, dict):
                             current_price = info.get('currentPrice') or info.get('regularMarketPrice') or 0
                     except: pass
@@ -474,7 +477,6 @@ def portfolio_list(request):
     ai_analysis = None
     if request.GET.get('analyze') == 'true' and items:
         # เลือก Gemini model ที่ดีที่สุดที่ตอบสนองได้
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
         model_name_to_use = 'gemini-2.5-flash'
 
         # สร้าง string สรุปพอร์ตสำหรับส่งให้ AI
@@ -595,11 +597,7 @@ def portfolio_list(request):
         3. DO NOT wrap the output in ```markdown code blocks. Start immediately with the analysis headings.
         """
         try:
-            response = client.models.generate_content(
-                model=model_name_to_use,
-                contents=prompt
-            )
-            ai_analysis = response.text
+            ai_analysis = llm_generate(prompt, use_case='portfolio_analysis', model=model_name_to_use, user=request.user)
 
             # ลบ markdown code block wrapper ถ้า AI ไม่ปฏิบัติตาม prompt
             # Strip any residual markdown blocks if AI disobeys
@@ -1057,33 +1055,19 @@ def portfolio_scan(request):
 
         import pandas_ta as ta
 
+        # แท่งราคา 1 ปีของทุกตัวจากคลังกลาง (คลังจัดการ fallback yahooquery ให้แล้ว)
+        from stocks.bar_store import get_bars
+        _bars = get_bars([f"{i.symbol.upper().replace('.BK', '')}.BK" for i in portfolio_items])
+
         for item in portfolio_items:
             symbol = item.symbol.upper().replace('.BK', '')
             try:
                 print(f"[PortfolioScan] Scanning {symbol}...")
-                df = yf.download(f"{symbol}.BK", period="1y", interval="1d", progress=False)
-
-                if df is None or df.empty:
-                    try:
-                        yq = YQTicker(f"{symbol}.BK")
-                        df = yq.history(period="1y", interval="1d")
-                        if isinstance(df, pd.DataFrame) and not df.empty:
-                            df = df.reset_index()
-                            if 'date' in df.columns:
-                                df.set_index('date', inplace=True)
-                            if 'symbol' in df.columns:
-                                df.drop(columns=['symbol'], inplace=True)
-                            df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low',
-                                               'close': 'Close', 'volume': 'Volume'}, inplace=True)
-                    except Exception:
-                        pass
+                df = _bars.get(f"{symbol}.BK")
 
                 if df is None or df.empty:
                     continue
 
-                if isinstance(df.columns, pd.MultiIndex):
-                    df.columns = df.columns.droplevel(1)
-
                 df = df.dropna(subset=['Close', 'High'])
                 if len(df) < 150:
                     continue
@@ -1613,58 +1597,50 @@ def tithe_mark_paid(request):
 @require_POST
 def portfolio_refresh_prices(request):
     """
-    Lightweight price refresh — fetches current price via fast_info (parallel)
+    Lightweight price refresh — fetches current prices in one batch via quote_service
     and updates highest_price in Portfolio if price has risen.
     Returns JSON: { updated: [...], skipped: [...], errors: [...] }
     """
-    import concurrent.futures
-
     from django.http import JsonResponse
 
+    from stocks.quote_service import get_live_prices
+
     items = list(Portfolio.objects.filter(user=request.user, category='STOCK'))
     if not items:
         return JsonResponse({'updated': [], 'skipped': [], 'errors': []})
 
-    def _fetch_price(item):
+    def _yf_symbol(item):
         symbol = item.symbol.upper()
         market = item.market  # 'SET', 'US', 'CRYPTO', 'OTHER'
 
         if market == 'SET':
-            sym_yf = symbol if symbol.endswith('.BK') else f"{symbol}.BK"
-        elif market == 'CRYPTO':
+            return symbol if symbol.endswith('.BK') else f"{symbol}.BK"
+        if market == 'CRYPTO':
             # BTC → BTC-USD, BTC-USD → BTC-USD (ใช้ตามที่บันทึกไว้)
-            sym_yf = symbol if '-' in symbol else f"{symbol}-USD"
-        else:
-            # US + OTHER: ใช้ symbol ตรงๆ (DELL, KEY, AAPL ฯลฯ)
-            sym_yf = symbol.replace('.BK', '')
+            return symbol if '-' in symbol else f"{symbol}-USD"
+        # US + OTHER: ใช้ symbol ตรงๆ (DELL, KEY, AAPL ฯลฯ)
+        return symbol.replace('.BK', '')
 
-        try:
-            fi = yf.Ticker(sym_yf).fast_info
-            price = float(getattr(fi, 'last_price', None) or 0)
-            return item, price
-        except Exception:
-            return item, 0.0
+    sym_of = {item.pk: _yf_symbol(item) for item in items}
+    try:
+        prices = get_live_prices(sym_of.values())
+    except Exception:
+        prices = {}
 
     updated, skipped, errors = [], [], []
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as ex:
-        futures = {ex.submit(_fetch_price, item): item for item in items}
-        for fut in concurrent.futures.as_completed(futures):
-            orig_item = futures[fut]
-            try:
-                item, price = fut.result(timeout=15)
-                if price <= 0:
-                    errors.append(item.symbol)
-                    continue
-                old_high = float(item.highest_price or 0)
-                if price > old_high:
-                    item.highest_price = price
-                    item.save(update_fields=['highest_price'])
-                    updated.append({'symbol': item.symbol, 'price': price, 'prev_high': old_high})
-                else:
-                    skipped.append({'symbol': item.symbol, 'price': price, 'highest': old_high})
-            except Exception:
-                errors.append(orig_item.symbol)
+    for item in items:
+        price = float(prices.get(sym_of[item.pk]) or 0)
+        if price <= 0:
+            errors.append(item.symbol)
+            continue
+        old_high = float(item.highest_price or 0)
+        if price > old_high:
+            item.highest_price = price
+            item.save(update_fields=['highest_price'])
+            updated.append({'symbol': item.symbol, 'price': price, 'prev_high': old_high})
+        else:
+            skipped.append({'symbol': item.symbol, 'price': price, 'highest': old_high})
 
     return JsonResponse({'updated': updated, 'skipped': skipped, 'errors': errors})
 
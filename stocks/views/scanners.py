@@ -1,115 +1,13 @@
 from .base import * 
 
+from stocks import scan_jobs as _scan_jobs
+
 from .base import (
     _get_usd_thb, _compute_signals, _get_market_condition, _get_precision_scan_data,
     _US_SECTOR_MAP, _US_MOMENTUM_SYMBOLS, _build_us_symbol_set, _is_us_symbol,
     _seed_us_symbols, _seed_value_symbols, _score_value_candidate, _check_rate_limit
 )
 
-# ============================================================
-# ฟังก์ชัน: _mr_detect_pattern
-# วัตถุประสงค์: ตรวจจับรูปแบบแท่งเทียนกลับตัวขาขึ้น (Bullish Reversal Patterns)
-#   เช่น Hammer, Pin Bar, Bullish Engulf, Morning Star
-#   ใช้ข้อมูล OHLC 2-3 แท่งล่าสุดในการวิเคราะห์
-# ============================================================
-def _mr_detect_pattern(df):
-    """Detect bullish reversal patterns for MR Scanner."""
-    if len(df) < 3:
-        return ''
-    try:
-        o1, h1, l1, c1 = float(df['Open'].iloc[-2]), float(df['High'].iloc[-2]), float(df['Low'].iloc[-2]), float(df['Close'].iloc[-2])
-        o0, h0, l0, c0 = float(df['Open'].iloc[-1]), float(df['High'].iloc[-1]), float(df['Low'].iloc[-1]), float(df['Close'].iloc[-1])
-        body0   = abs(c0 - o0)
-        range0  = h0 - l0
-        if range0 == 0:
-            return ''
-        upper0 = h0 - max(c0, o0)
-        lower0 = min(c0, o0) - l0
-        # Hammer
-        if lower0 >= 2 * max(body0, 0.0001) and lower0 >= 2 * max(upper0, 0.0001) and c0 >= l0 + range0 * 0.5:
-            return 'Hammer'
-        # Pin Bar
-        if lower0 >= 2.5 * max(upper0, 0.0001) and body0 < range0 * 0.35:
-            return 'Pin Bar'
-        # Bullish Engulf
-        body1 = abs(c1 - o1)
-        if c1 < o1 and c0 > o0 and c0 > o1 and o0 <= c1 and body0 > body1 * 0.9:
-            return 'Bullish Engulf'
-        # Morning Star
-        if len(df) >= 3:
-            o2, c2 = float(df['Open'].iloc[-3]), float(df['Close'].iloc[-3])
-            body2 = abs(c2 - o2)
-            if c2 < o2 and body1 < max(body2, 0.0001) * 0.5 and c0 > o0 and c0 > (o2 + c2) / 2:
-                return 'Morning Star'
-    except Exception:
-        pass
-    return ''
-
-
-# ============================================================
-# ฟังก์ชัน: _mr_swing_support
-# วัตถุประสงค์: หาแนวรับ (Swing Low) ที่ใกล้ที่สุดต่ำกว่าราคาปัจจุบัน
-#   ใช้ lookback bar ย้อนหลังเพื่อหาจุดต่ำสุดเฉพาะที่ในกราฟ
-# ============================================================
-def _mr_swing_support(df, lookback=60):
-    """Nearest swing low below current price."""
-    try:
-        curr  = float(df['Close'].iloc[-1])
-        lows  = df['Low'].tail(lookback).values
-        swing = [lows[i] for i in range(2, len(lows) - 2) if lows[i] == min(lows[i-2:i+3])]
-        below = [s for s in swing if s < curr]
-        return max(below) if below else None
-    except Exception:
-        return None
-
-
-# ============================================================
-# ฟังก์ชัน: _mr_swing_resistance
-# วัตถุประสงค์: หาแนวต้าน (Swing High) ที่ใกล้ที่สุดสูงกว่าราคาปัจจุบัน
-#   ใช้ lookback bar ย้อนหลังเพื่อหาจุดสูงสุดเฉพาะที่ในกราฟ
-# ============================================================
-def _mr_swing_resistance(df, lookback=60):
-    """Nearest swing high above current price."""
-    try:
-        curr   = float(df['Close'].iloc[-1])
-        highs  = df['High'].tail(lookback).values
-        swing  = [highs[i] for i in range(2, len(highs) - 2) if highs[i] == max(highs[i-2:i+3])]
-        above  = [s for s in swing if s > curr]
-        return min(above) if above else None
-    except Exception:
-        return None
-
-
-# ============================================================
-# ฟังก์ชัน: _mr_r_score
-# วัตถุประสงค์: คำนวณ Mean Reversion Score (0-100)
-#   รวมปัจจัย: ADX (ความแข็งแกร่งของเทรนด์), RSI (Overbought/Oversold),
-#   Relative Volume (ปริมาณการซื้อขายสัมพัทธ์), รูปแบบแท่งเทียน,
-#   และระยะห่างจากแนวรับ — คะแนนสูง = โอกาสกลับตัวสูง
-# ============================================================
-def _mr_r_score(rsi, adx, rvol, pattern, direction, dist_support_pct):
-    score = 50
-    if adx < 15:   score += 15
-    elif adx < 20: score += 10
-    elif adx < 25: score += 5
-    if direction == 'oversold':
-        if rsi < 25:   score += 20
-        elif rsi < 30: score += 12
-        elif rsi < 35: score += 6
-    else:
-        if rsi > 75:   score += 20
-        elif rsi > 70: score += 12
-        elif rsi > 65: score += 6
-    if rvol > 1.5:   score += 15
-    elif rvol > 1.2: score += 8
-    elif rvol > 1.0: score += 3
-    bonus = {'Bullish Engulf': 20, 'Morning Star': 18, 'Hammer': 15, 'Pin Bar': 12}
-    score += bonus.get(pattern, 0)
-    if dist_support_pct < 2.0:   score += 10
-    elif dist_support_pct < 5.0: score += 5
-    return min(100, score)
-
-
 _mr_bg_cache = {}
 
 
@@ -151,131 +49,53 @@ def mean_reversion_scanner(request):
             sym_list = [c.symbol for c in candidates]
             
             if sym_list:
-                import concurrent.futures as cf
                 from datetime import datetime as _dt
                 from datetime import timedelta as _td
 
-                import pandas as pd
-                import pandas_ta as ta
                 import pytz
-                import yfinance as yf
-                
+
+                from stocks.bar_store import get_bars
+                from stocks.scan_evaluators import evaluate_mean_reversion_symbol
+                from stocks.scan_executor import run_cpu_stage
+
                 _tz = pytz.timezone('Asia/Bangkok') if market == 'SET' else pytz.utc
                 now = _dt.now(_tz)
                 end = (now.date() + _td(days=1)).strftime('%Y-%m-%d')
                 start = (now.date() - _td(days=300)).strftime('%Y-%m-%d')
-                
-                def _refresh_one(c):
-                    try:
-                        sym = c.symbol
-                        fetch = f'{sym}.BK' if market == 'SET' else sym
-                        df = yf.Ticker(fetch).history(start=start, end=end, interval='1d')
-                        if df is None or df.empty or len(df) < 60:
-                            return None
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.droplevel(1)
-                        df = df.dropna(subset=['Close', 'High', 'Low', 'Open'])
-                        
-                        curr = float(df['Close'].iloc[-1])
-                        avg_vol = float(df['Volume'].tail(20).mean())
-                        if avg_vol == 0:
-                            return None
-                        
-                        adx_v = 30.0
-                        try:
-                            adf = ta.adx(df['High'], df['Low'], df['Close'], 14)
-                            ac = [col for col in adf.columns if col.startswith('ADX_')]
-                            if ac:
-                                adx_v = float(adf[ac[0]].iloc[-1])
-                        except Exception:
-                            pass
-                            
-                        rsi_v = 50.0
-                        try:
-                            rs = ta.rsi(df['Close'], 14)
-                            if rs is not None and pd.notna(rs.iloc[-1]):
-                                rsi_v = float(rs.iloc[-1])
-                        except Exception:
-                            pass
-                        
-                        direction = 'oversold' if rsi_v < 35 else 'overbought'
-                        pattern = _mr_detect_pattern(df)
-                        rvol = float(df['Volume'].iloc[-1]) / avg_vol if avg_vol > 0 else 1.0
-                        support = _mr_swing_support(df)
-                        resistance = _mr_swing_resistance(df)
-                        dist_sup = ((curr - support) / support * 100) if support else 999.0
-                        dist_res = ((resistance - curr) / curr * 100) if resistance else 999.0
-                        
-                        mean_tgt = None
-                        try:
-                            s20 = ta.sma(df['Close'], 20)
-                            if s20 is not None and pd.notna(s20.iloc[-1]):
-                                mean_tgt = float(s20.iloc[-1])
-                        except Exception:
-                            pass
-                            
-                        upside = ((mean_tgt - curr) / curr * 100) if mean_tgt and curr > 0 else 0.0
-                        
-                        rs_raw = 0.0
-                        if len(df) >= 66:
-                            c66 = float(df['Close'].iloc[-66])
-                            if c66 > 0:
-                                rs_raw = (curr - c66) / c66 * 100
-                                
-                        r_score = _mr_r_score(rsi_v, adx_v, rvol, pattern, direction, dist_sup)
-                        
-                        return {
-                            'id': c.id,
-                            'price': round(curr, 4),
-                            'direction': direction,
-                            'rsi': round(rsi_v, 1),
-                            'adx': round(adx_v, 1),
-                            'avg_vol': avg_vol,
-                            'rvol': round(rvol, 2),
-                            'pattern': pattern,
-                            'support': support,
-                            'resistance': resistance,
-                            'dist_sup': round(dist_sup, 2),
-                            'dist_res': round(dist_res, 2),
-                            'mean_tgt': mean_tgt,
-                            'upside': round(upside, 2),
-                            'r_score': r_score,
-                        }
-                    except Exception:
-                        return None
-                
-                with cf.ThreadPoolExecutor(max_workers=5) as ex:
-                    futures = {ex.submit(_refresh_one, c): c for c in candidates}
-                    for fut in cf.as_completed(futures):
-                        res = fut.result()
-                        if res:
-                            _MRC.objects.filter(id=res['id']).update(
-                                price=res['price'],
-                                direction=res['direction'],
-                                rsi=res['rsi'],
-                                adx=res['adx'],
-                                avg_vol_20d=res['avg_vol'],
-                                rvol=res['rvol'],
-                                pattern=res['pattern'],
-                                support_level=res['support'],
-                                resistance_level=res['resistance'],
-                                dist_to_support_pct=res['dist_sup'],
-                                dist_to_resistance_pct=res['dist_res'],
-                                mean_target=res['mean_tgt'],
-                                upside_pct=res['upside'],
-                                r_score=res['r_score']
-                            )
+
+                _key = (lambda s: f'{s}.BK') if market == 'SET' else None
+                _bars = get_bars([_key(s) if _key else s for s in sym_list], start, end)
+
+                # คำนวณค่าใหม่ใน process pool (ไม่กรอง — หุ้นอยู่ในตารางแล้ว) แล้วอัปเดตแถวเดิมของรอบล่าสุด
+                for res in run_cpu_stage(evaluate_mean_reversion_symbol, sorted(set(sym_list)), _bars,
+                                         ctx={'market': market, 'screen': False}, bar_key=_key):
+                    _MRC.objects.filter(id__in=[c.id for c in candidates if c.symbol == res['symbol']]).update(
+                        price=res['price'],
+                        direction=res['direction'],
+                        rsi=res['rsi'],
+                        adx=res['adx'],
+                        avg_vol_20d=res['avg_vol'],
+                        rvol=res['rvol'],
+                        pattern=res['pattern'],
+                        support_level=res['support'],
+                        resistance_level=res['resistance'],
+                        dist_to_support_pct=res['dist_sup'],
+                        dist_to_resistance_pct=res['dist_res'],
+                        mean_target=res['mean_tgt'],
+                        upside_pct=res['upside'],
+                        r_score=res['r_score']
+                    )
                 messages.success(request, f"อัปเดตราคาล่าสุดเฉพาะหุ้น {len(sym_list)} ตัวในตารางเรียบร้อยแล้ว!")
         return redirect(f"{request.path}?market={market}&direction={request.GET.get('direction', 'all')}&min_score={request.GET.get('min_score', 60)}&run_idx={request.GET.get('run_idx', 0)}")
 
     if request.GET.get('scan_status') == '1':
-        st = _cp.get(cache_key, {'state': 'idle'})
+        st = _scan_jobs.get(cache_key)
         if st.get('state') == 'done':
-            _cp.delete(cache_key)
+            _scan_jobs.clear(cache_key)
         return _JR(st)
 
     if request.GET.get('scan') == 'true' or request.method == 'POST':
-        if _mr_bg_cache.get(cache_key, {}).get('state') == 'running':
+        if _scan_jobs.get(cache_key, {}).get('state') == 'running':
             return redirect('stocks:mean_reversion_scanner')
 
         if market == 'SET':
@@ -288,24 +108,18 @@ def mean_reversion_scanner(request):
                 _seed_us_symbols()
                 sym_list = list(_SS.objects.filter(is_active=True, market='US').values_list('symbol', flat=True))
 
-        _cp.set(cache_key, {'state': 'running', 'progress': 0, 'total': len(sym_list), 'phase': 'เริ่มสแกน Mean Reversion…'}, timeout=900)
+        if not _scan_jobs.start(cache_key, user_id, {'state': 'running', 'progress': 0, 'total': len(sym_list), 'phase': 'เริ่มสแกน Mean Reversion…'}):
+            return redirect('stocks:mean_reversion_scanner')
 
         def _run_mr(uid, ckey, syms, mkt):
             try:
                 import django; django.setup()
-                import concurrent.futures as cf
-                import logging
                 from datetime import datetime as _dt
                 from datetime import timedelta as _td
 
-                import pandas as pd
-                import pandas_ta as ta
                 import pytz
-                import yfinance as yf
                 from django.contrib.auth import get_user_model
-                from django.core.cache import cache as _c
                 from django.utils import timezone as tz
-                _log = logging.getLogger('stocks.mean_reversion')
 
                 User = get_user_model()
                 user = User.objects.get(pk=uid)
@@ -321,124 +135,27 @@ def mean_reversion_scanner(request):
                 if old:
                     _MRC.objects.filter(user=user, market=mkt, scan_run__in=old).delete()
 
-                results = []
-
-                def _scan_one(sym):
-                    try:
-                        fetch = f'{sym}.BK' if mkt == 'SET' else sym
-                        df = yf.Ticker(fetch).history(start=start, end=end, interval='1d')
-                        if df is None or df.empty or len(df) < 60:
-                            return None
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.droplevel(1)
-                        df = df.dropna(subset=['Close', 'High', 'Low', 'Open'])
-
-                        curr    = float(df['Close'].iloc[-1])
-                        avg_vol = float(df['Volume'].tail(20).mean())
-                        if avg_vol == 0:
-                            return None
-
-                        # Liquidity filter
-                        if mkt == 'SET' and avg_vol * curr < 500_000:
-                            return None
-                        if mkt == 'US' and avg_vol < 200_000:
-                            return None
+                from stocks.bar_store import get_bars
+                _scan_jobs.update(ckey, {'state': 'running', 'progress': 0, 'total': len(syms), 'phase': 'โหลดข้อมูลราคา…'})
+                _bars = get_bars([f'{s}.BK' if mkt == 'SET' else s for s in syms], start, end)
 
-                        # ADX filter — must be range-bound
-                        adx_v = 30.0
-                        try:
-                            adf = ta.adx(df['High'], df['Low'], df['Close'], 14)
-                            ac  = [c for c in adf.columns if c.startswith('ADX_')]
-                            if ac:
-                                adx_v = float(adf[ac[0]].iloc[-1])
-                        except Exception as e:
-                            _log.debug(f'MR ADX {sym}: {e}')
-                        if adx_v >= 25:
-                            return None
-
-                        # RSI filter
-                        rsi_v = 50.0
-                        try:
-                            rs = ta.rsi(df['Close'], 14)
-                            if rs is not None and pd.notna(rs.iloc[-1]):
-                                rsi_v = float(rs.iloc[-1])
-                        except Exception as e:
-                            _log.debug(f'MR RSI {sym}: {e}')
-
-                        if rsi_v >= 35 and rsi_v <= 65:
-                            return None   # neutral zone — skip
-
-                        direction = 'oversold' if rsi_v < 35 else 'overbought'
+                from stocks.scan_evaluators import evaluate_mean_reversion_symbol
+                from stocks.scan_executor import run_cpu_stage
 
-                        # Pattern detection
-                        pattern = _mr_detect_pattern(df)
+                # ประเมินทีละหุ้นใน process pool (stocks.scan_executor) — ฝั่งนี้แค่รายงานความคืบหน้า
+                def _on_progress(done, total):
+                    if done % 20 == 0:
+                        _scan_jobs.update(ckey, {'state': 'running', 'progress': done, 'total': total,
+                                                 'phase': f'สแกน {done}/{total}…'})
 
-                        # Volume confirmation: rvol
-                        rvol = float(df['Volume'].iloc[-1]) / avg_vol if avg_vol > 0 else 1.0
+                results = run_cpu_stage(evaluate_mean_reversion_symbol, syms, _bars, ctx={'market': mkt},
+                                        bar_key=(lambda s: f'{s}.BK') if mkt == 'SET' else None,
+                                        on_progress=_on_progress)
 
-                        # Support / Resistance
-                        support    = _mr_swing_support(df)
-                        resistance = _mr_swing_resistance(df)
-                        dist_sup   = ((curr - support) / support * 100) if support else 999.0
-                        dist_res   = ((resistance - curr) / curr * 100) if resistance else 999.0
-
-                        # Mean target: SMA20
-                        mean_tgt = None
-                        try:
-                            s20 = ta.sma(df['Close'], 20)
-                            if s20 is not None and pd.notna(s20.iloc[-1]):
-                                mean_tgt = float(s20.iloc[-1])
-                        except Exception:
-                            pass
-
-                        upside = ((mean_tgt - curr) / curr * 100) if mean_tgt and curr > 0 else 0.0
-
-                        # 3-month RS raw
-                        rs_raw = 0.0
-                        if len(df) >= 66:
-                            c66 = float(df['Close'].iloc[-66])
-                            if c66 > 0:
-                                rs_raw = (curr - c66) / c66 * 100
-
-                        r_score = _mr_r_score(rsi_v, adx_v, rvol, pattern, direction, dist_sup)
-
-                        return {
-                            'symbol': sym, 'price': round(curr, 4),
-                            'direction': direction, 'rsi': round(rsi_v, 1),
-                            'adx': round(adx_v, 1), 'avg_vol': avg_vol,
-                            'rvol': round(rvol, 2), 'pattern': pattern,
-                            'support': support, 'resistance': resistance,
-                            'dist_sup': round(dist_sup, 2), 'dist_res': round(dist_res, 2),
-                            'mean_tgt': mean_tgt, 'upside': round(upside, 2),
-                            'rs_raw': rs_raw, 'r_score': r_score,
-                        }
-                    except Exception as e:
-                        _log.debug(f'MR scan {sym}: {e}')
-                        return None
-
-                done = 0
-                total = len(syms)
-                with cf.ThreadPoolExecutor(max_workers=5) as ex:
-                    futs = {ex.submit(_scan_one, s): s for s in syms}
-                    for fut in cf.as_completed(futs):
-                        done += 1
-                        if done % 20 == 0:
-                            _c.set(ckey, {'state': 'running', 'progress': done, 'total': total,
-                                          'phase': f'สแกน {done}/{total}…'}, timeout=900)
-                        try:
-                            r = fut.result()
-                            if r:
-                                results.append(r)
-                        except Exception as e:
-                            _log.debug(f'MR future {futs[fut]}: {e}')
-
-                # RS percentile ranking
-                import pandas as _pd
-                rs_map = {}
-                rs_vals = {r['symbol']: r['rs_raw'] for r in results}
-                if rs_vals:
-                    ser = _pd.Series(rs_vals)
-                    rs_map = (ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
+                # RS percentile ranking — RS 3 เดือนของทั้งตลาดจาก RelativeStrengthSnapshot
+                # (ยังไม่มี snapshot → rank ภายในผลสแกนรอบนี้แบบเดิม)
+                from stocks.rs_engine import get_rs_ratings
+                rs_map = get_rs_ratings(mkt, 'rs_3m_rating', fallback={r['symbol']: r['rs_raw'] for r in results})
 
                 bulk = [_MRC(
                     user=user, scan_run=scan_run, symbol=r['symbol'],
@@ -453,13 +170,12 @@ def mean_reversion_scanner(request):
                     r_score=r['r_score'], rs_rating=rs_map.get(r['symbol'], 0),
                 ) for r in results]
                 _MRC.objects.bulk_create(bulk)
-                _c.set(ckey, {'state': 'done'}, timeout=300)
+                _scan_jobs.update(ckey, {'state': 'done'})
 
             except Exception as exc:
                 import logging as _l
                 _l.getLogger('stocks').exception(f'[MR Scanner] bg error: {exc}')
-                from django.core.cache import cache as _c2
-                _c2.set(ckey, {'state': 'done'}, timeout=300)
+                _scan_jobs.update(ckey, {'state': 'done'})
 
         _thr.Thread(target=_run_mr, args=(user_id, cache_key, sym_list, market), daemon=True).start()
         return redirect(f'{request.path}?market={market}')
@@ -757,15 +473,13 @@ def recommendations(request):
     # Generate Report
     report_text = None
     if request.GET.get('analyze') == 'true' and stock_previews:
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
         data_str = "\n".join([f"{s['symbol']} Price:{s['price']} Score:{s['value_score']} PEG:{s['peg']}" for s in stock_previews[:30]])
         prompt = f"""คุณคือนักวิเคราะห์หุ้นที่เน้น Maximum Returns ในปี 2026 โดยใช้สไตล์ Peter Lynch (GARP) และ Greenblatt (Magic Formula) เป็นหลัก
         นี่คือข้อมูลหุ้น 30 อันดับแรก:
         {data_str}
         โปรดวิเคราะห์หุ้นที่น่าเข้าซื้อที่สุดสำหรับปี 2026 ภายใต้ธีม AI และ พลังงานสะอาด เขียนรายงานภาษาไทยแบบมืออาชีพ เจาะลึกรายตัวท็อป 10"""
         try:
-            response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-            report_text = response.text
+            report_text = llm_generate(prompt, use_case='stock_recommendations', model='gemini-2.5-flash', user=request.user)
             if report_text.startswith("```markdown"): report_text = report_text[11:].strip()
             if report_text.endswith("```"): report_text = report_text[:-3].strip()
         except Exception as e: report_text = f"Error: {e}"
@@ -956,12 +670,10 @@ def us_recommendations(request):
 
     report_text = None
     if request.GET.get('analyze') == 'true' and stock_previews:
-        client = genai.Client(api_key=settings.GEMINI_API_KEY)
         data_str = "\n".join([f"{s['symbol']} Price:{s['price']} Score:{s['value_score']} PEG:{s['peg']}" for s in stock_previews[:20]])
         prompt = f"คุณคือนักวิเคราะห์หุ้นอเมริกัน เน้น Maximum Returns ปี 2026 โดยใช้ Lynch และ Greenblatt สแกนหุ้น {data_str} โปรดสรุปตัวท็อปในธีม AI/Semiconductor/Energy ภาษาไทย"
         try:
-            response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-            report_text = response.text
+            report_text = llm_generate(prompt, use_case='stock_recommendations', model='gemini-2.5-flash', user=request.user)
         except: report_text = "Analysis service unavailable."
 
     context = {
@@ -977,532 +689,341 @@ def us_recommendations(request):
 
 # ====== Morning Briefing - รายงานสรุปประจำวัน ======
 
+# ----------------------------------------------------------------------
+# ส่วนร่วมของ scanner ที่สแกนใน background thread บน stocks.scan_pipeline (Momentum / Cup & Handle / SEPA)
+# ----------------------------------------------------------------------
+def _scan_status_response(job_key):
+    """AJAX poll สถานะงานสแกน — สถานะ done ถูกอ่านครั้งเดียวแล้วล้าง"""
+    from django.http import JsonResponse
+    st = _scan_jobs.get(job_key)
+    if st.get('state') == 'done':
+        _scan_jobs.clear(job_key)
+    return JsonResponse(st)
+
+
+def _start_scan_thread(job_key, user_id, target, market_code, phase='เตรียมข้อมูล…'):
+    """
+    เปิด background thread target(market_code, user_id, job_key) แล้ว return ทันที
+    scan_jobs.start() เป็น atomic lock — กด scan ซ้ำระหว่างงานเดิมยังรันอยู่จะไม่เปิด thread ซ้อน
+    """
+    import threading
+    if _scan_jobs.start(job_key, user_id, {'state': 'running', 'progress': 0, 'total': 0, 'phase': phase}):
+        threading.Thread(target=target, args=(market_code, user_id, job_key), daemon=True).start()
+
+
+def _attach_live_status(candidates, live_map, prev_close_map):
+    """ราคาล่าสุด + สถานะเทียบโซนซื้อ/TP ของผลสแกน (ใช้แสดงผลเท่านั้น ไม่เขียนกลับ DB)"""
+    for c in candidates:
+        lp = live_map.get(c.symbol)
+        pc = prev_close_map.get(c.symbol) or float(c.price or 0)
+        c.live_price = lp
+        ref = lp if lp else float(c.price or 0)
+        dz_s = float(c.demand_zone_start or 0)
+        dz_e = float(c.demand_zone_end or 0)
+        sz_s = float(c.supply_zone_start or 0)
+        c.live_in_zone = dz_s > 0 and dz_e > 0 and dz_e <= ref <= dz_s
+        c.live_broke_zone = dz_e > 0 and ref < dz_e
+        c.live_above_tp = sz_s > 0 and ref >= sz_s
+        c.live_near_tp = (
+            not c.live_above_tp and sz_s > 0 and dz_s > 0 and
+            (sz_s - dz_s) > 0 and (sz_s - ref) / (sz_s - dz_s) * 100 <= 15
+        )
+        c.live_zone_prox = (
+            0.0 if ref <= dz_s else
+            round((ref - dz_s) / dz_s * 100, 1) if dz_s > 0 else 999
+        )
+        c.live_change_pct = round((lp - pc) / pc * 100, 2) if lp and pc > 0 else None
+
+
+def _trailing_status(user, market):
+    """
+    Let Profit Run — badge ของหุ้นในพอร์ตที่ล็อกกำไรบางส่วนไปแล้วและกำลังเทรลราคาส่วนที่เหลือ (tp1_hit=True)
+    key เป็นชื่อหุ้นแบบไม่มี suffix ตลาด (ตรงกับ symbol ของผลสแกน)
+    """
+    from stocks.models import Portfolio
+    from stocks.utils import simple_trailing_stop
+    trailing_status = {}
+    for p in Portfolio.objects.filter(user=user, market=market.code, tp1_hit=True):
+        ep = float(p.entry_price or 0)
+        gain_pct = ((float(p.highest_price or 0) - ep) / ep * 100) if ep > 0 and p.highest_price else None
+        trailing_status[market.plain(p.symbol.upper())] = {
+            'trail_stop': simple_trailing_stop(p.highest_price, p.atr, p.trail_multiplier),
+            'tp1_price': p.tp1_price,
+            'gain_pct': gain_pct,
+        }
+    return trailing_status
+
+
 # ============================================================
-# ฟังก์ชัน: momentum_scanner
-# วัตถุประสงค์: สแกนหาหุ้นที่มี Momentum แข็งแกร่ง (SET Market)
-#   วิเคราะห์ปัจจัย: RS Score, Volume Surge, Price Action,
-#   Trend Alignment และ Market Regime เพื่อคัดกรองหุ้นแนวโน้มขาขึ้น
+# Momentum Scanner (SET / US) — สแกนผ่าน stocks.momentum_scan, หน้าแสดงผลใช้ร่วมกันใน _momentum_scanner_view
 # ============================================================
-@login_required
-def momentum_scanner(request):
+_MOMENTUM_SORTS = {
+    'symbol':          'symbol',
+    'score':           '-technical_score',
+    'technical_score': '-technical_score',
+    'rs':              '-rs_rating',
+    'rs_rating':       '-rs_rating',
+    'rsi':             '-rsi',
+    'rvol':            '-rvol',
+    'adx':             '-adx',
+    'mfi':             '-mfi',
+    'price':           '-price',
+    'eps':             '-eps_growth',
+    'rev':             '-rev_growth',
+    'gap':             'upside_to_high',
+    'upside':          '-upside_to_high',
+    'prox':            'zone_proximity',
+    'round_rr':        '-risk_reward_ratio',
+    'rel1m':           '-rel_1m',
+}
+
+
+def _momentum_ai_set(request, candidates):
+    data = [
+        {'symbol': c.symbol, 'score': c.technical_score, 'rvol': c.rvol, 'rsi': c.rsi,
+         'eps_growth': c.eps_growth, 'rev_growth': c.rev_growth, 'upside': c.upside_to_high}
+        for c in sorted(candidates, key=lambda c: c.technical_score, reverse=True)[:15]
+    ]
+    if not data:
+        return ""
+    prompt = f"หุ้นไทย Momentum แรงที่สุด 15 ตัวจากระบบสแกน: {json.dumps(data)}\nช่วยวิเคราะห์และคัดเลือก 3-5 ตัวที่น่าสนใจที่สุด พร้อมเหตุผลเชิงกลยุทธ์ตามสไตล์ Mark Minervini และบอกจุดระวัง"
+    return analyze_with_ai(prompt)
+
+
+def _momentum_ai_us(request, candidates):
+    syms = [c.symbol for c in candidates[:30]]
+    if not syms:
+        return None
+    prompt = f"""You are a top US momentum stock analyst using Minervini/O'Neil methodology.
+
+From this list of US stocks that passed the Trend Template filter:
+{', '.join(syms)}
+
+Analyze current news, earnings momentum, sector rotation, and market sentiment to identify
+the top 5-7 "Superperformance" candidates most likely to make significant moves in the next 2-6 weeks.
+
+Write in Thai language, markdown format:
+- For each pick: symbol, why it's the leader (RS Rating, Stage 2, Catalyst), key risk
+- Focus on Relative Strength leaders and stocks near breakout pivots
+- Note any Earnings dates or Fed events to watch
+- No intro, no outro"""
+    ai_analysis = llm_generate(prompt, use_case='stock_recommendations', model='gemini-2.5-flash', user=request.user)
+    if ai_analysis and ai_analysis.startswith("```"):
+        ai_analysis = ai_analysis.split('\n', 1)[-1].rsplit('```', 1)[0].strip()
+    return ai_analysis
+
+
+# หน้า/การแสดงผลของ Momentum Scanner แต่ละตลาด — เกณฑ์การสแกนอยู่ใน stocks.momentum_scan.RULES
+#   regime_index: ดัชนีที่ใช้ทำ Markov Market Regime Pulse (None = ไม่แสดง)
+#   fresh_zones:  คำนวณ Demand/Supply zone ใหม่จากแท่งที่ปิดแล้วทุกครั้งที่เปิดหน้า (ตามเวลาทำการ SET)
+_MOMENTUM_PAGES = {
+    'SET': {'title': 'Global Momentum Scanner (CAN SLIM)', 'template': 'stocks/momentum.html',
+            'url_name': 'stocks:momentum_scanner', 'job': 'momentum_scan',
+            'regime_index': '^SET.BK', 'fresh_zones': True, 'ai': _momentum_ai_set},
+    'US': {'title': 'US Momentum Scanner', 'template': 'stocks/us_momentum.html',
+           'url_name': 'stocks:us_momentum_scanner', 'job': 'us_momentum_scan',
+           'regime_index': None, 'fresh_zones': False, 'ai': _momentum_ai_us},
+}
+
+
+def _momentum_fresh_zones(candidates, market):
     """
-    Globally scans SET100 roughly matching Mark Minervini Trend Template.
-    Runs in a background thread to avoid 504 timeout.
+    Demand/Supply zone ล่าสุดจากแท่งในคลังกลาง → {symbol: zone}
+    end date เหมือน entry_finder — ห้ามรวมแท่งที่ยังไม่ปิดของวันนี้ตอนตลาดเปิด
     """
-    import threading as _th
+    from datetime import datetime as _mdt
+    from datetime import time as _mtime
+    from datetime import timedelta as _mtd
+
+    import pytz as _mpytz
+
+    from stocks.bar_store import get_bars
+    from stocks.scan_evaluators import evaluate_supply_demand_zone
+    from stocks.scan_executor import run_cpu_stage
+    _mnow = _mdt.now(_mpytz.timezone('Asia/Bangkok'))
+    _market_open_now = _mnow.weekday() < 5 and _mnow.time() <= _mtime(16, 30)
+    _mend_date = (_mnow.date() - _mtd(days=1)) if _market_open_now else _mnow.date()
+    keys = {c.symbol: market.yahoo(c.symbol) for c in candidates}
+    bars = get_bars(list(keys.values()), (_mend_date - _mtd(days=600)).strftime('%Y-%m-%d'),
+                    _mend_date.strftime('%Y-%m-%d'))
+    return {
+        r['symbol']: r['zone']
+        for r in run_cpu_stage(evaluate_supply_demand_zone, list(keys), bars, bar_key=keys.get)
+    }
 
-    from django.core.cache import cache as _cp
-    from django.http import JsonResponse as _JR
 
-    user_id   = request.user.id
-    cache_key = f'momentum_scan_{user_id}'
+def _momentum_top_picks(candidates):
+    """Top Picks: คัดอัตโนมัติ 4 ด่าน (พื้นฐาน → RSI → แรง → จัดลำดับ) — ต้องมี EPS/Revenue growth ในผลสแกน"""
+    _pool = []
+    for c in candidates:
+        eps  = float(c.eps_growth or 0)
+        rev  = float(c.rev_growth or 0)
+        rsi  = float(c.rsi or 0)
+        adx  = float(c.adx or 0)
+        # ด่าน 1: พื้นฐานต้องโตจริงอย่างน้อยหนึ่งด้าน (EPS หรือ Revenue ≥ 10%)
+        if eps < 10 and rev < 10:
+            continue
+        # ด่าน 1.5: Revenue ห้ามติดลบ — EPS โตแต่รายได้หด = กำไรจากรายการพิเศษ/ฐานต่ำ ไม่ใช่ธุรกิจโต
+        if rev < 0:
+            continue
+        # ด่าน 2: ตัดของร้อนจัด (RSI ≥ 80 ไล่ไม่ได้ ถือก็เสียว)
+        if rsi >= 80:
+            continue
+        # ด่าน 3: ต้องมีแรงขับ (ADX ≥ 20 — ถ้าไม่มีข้อมูล ADX ให้ผ่าน)
+        if adx and adx < 20:
+            continue
+        _pool.append(c)
+    # ด่าน 4: เรียงคุณภาพ (EPS+REV) → ความคุ้ม (RR) → ความสด (RVOL)
+    _pool.sort(key=lambda c: (
+        float(c.eps_growth or 0) + float(c.rev_growth or 0),
+        float(c.risk_reward_ratio or 0),
+        float(c.rvol or 0)
+    ), reverse=True)
 
-    # --- Markov Market Regime Pulse ---
-    from django.core.cache import cache
+    top_picks = []
+    for c in _pool[:7]:
+        rsi  = float(c.rsi or 0)
+        rvol = float(c.rvol or 0)
+        dz_s = float(c.demand_zone_start or 0)
+        dz_e = float(c.demand_zone_end or 0)
+        zone_txt = f"{dz_e:.2f}–{dz_s:.2f}" if dz_s > 0 else "-"
+        if getattr(c, 'live_in_zone', False):
+            status, action = 'enter', f'อยู่ในโซนซื้อ {zone_txt} — เข้าได้ (เช็ค Precision ก่อนกด)'
+        elif getattr(c, 'live_above_tp', False):
+            status, action = 'skip', 'ถึง TP แล้ว — ห้ามไล่ รอสร้างฐานใหม่'
+        elif rsi >= 75:
+            status, action = 'wait', f'RSI {rsi:.0f} ร้อน — รอย่อเข้าโซน {zone_txt}'
+        elif rvol < 0.8:
+            status, action = 'wait', f'Volume ยังหลับ ({rvol:.1f}x) — ตั้ง alert โซน {zone_txt}'
+        elif getattr(c, 'live_near_tp', False):
+            status, action = 'wait', f'ใกล้ TP เหลือ upside น้อย — รอย่อโซน {zone_txt}'
+        else:
+            status, action = 'alert', f'ตั้ง alert โซนซื้อ {zone_txt}'
+        _lp = getattr(c, 'live_price', None)
+        top_picks.append({
+            'symbol': c.symbol,
+            'price': float(_lp) if _lp else float(c.price or 0),
+            'change_pct': getattr(c, 'live_change_pct', None),
+            'eps': float(c.eps_growth or 0),
+            'rev': float(c.rev_growth or 0),
+            'rr': float(c.risk_reward_ratio or 0),
+            'rvol': rvol,
+            'rsi': rsi,
+            'status': status,
+            'action': action,
+        })
+    return top_picks
 
-    from stocks.utils import calculate_markov_regime
-    regime_cache_key = 'markov_regime_SET' # Momentum mainly for SET
-    regime = cache.get(regime_cache_key)
-    if not regime:
-        regime = calculate_markov_regime('^SET.BK')
-        cache.set(regime_cache_key, regime, timeout=1800)
+
+def _momentum_scanner_view(request, market_code):
+    """
+    เนื้อหาร่วมของ momentum_scanner (SET) และ us_momentum_scanner (US)
+    POST หรือ ?scan=true → รัน stocks.momentum_scan.run_momentum_scan ใน background thread
+    GET → แสดงผลสแกนล่าสุดพร้อม live price / สถานะโซน / Let Profit Run (+ Top Picks ของตลาดที่มีข้อมูลพื้นฐาน)
+    """
+    from stocks.momentum_scan import RULES, run_momentum_scan
+    from stocks.scan_pipeline import MARKETS
+
+    market = MARKETS[market_code]
+    page = _MOMENTUM_PAGES[market_code]
+    cache_key = f"{page['job']}_{request.user.id}"
 
     # ── AJAX status poll ──────────────────────────────────────────────
     if request.GET.get('scan_status') == '1':
-        st = _cp.get(cache_key, {'state': 'idle'})
-        if st.get('state') == 'done':
-            _cp.delete(cache_key)
-        elif st.get('state') == 'running':
-            import time as _tm
-            st_time = st.get('timestamp', 0)
-            if (st.get('total', 0) == 0 and st.get('progress', 0) == 0) or (_tm.time() - st_time > 60):
-                _cp.delete(cache_key)
-                st = {'state': 'idle'}
-        return _JR(st)
+        return _scan_status_response(cache_key)
 
     # ── Trigger background scan ───────────────────────────────────────
     if request.GET.get('scan') == 'true' or request.method == 'POST':
-        from stocks.utils import get_top_ranked_symbols, refresh_all_thai_symbols
-        # ใช้ Top 300 หุ้นใหญ่เท่านั้นเพื่อความเร็วและคุณภาพ
-        scan_symbols = get_top_ranked_symbols(market='SET', limit=300, auto_refresh=True)
-        
-        if not scan_symbols:
-            refresh_all_thai_symbols()
-            scan_symbols = get_top_ranked_symbols(market='SET', limit=300, auto_refresh=True)
-
-        already = _cp.get(cache_key, {})
-        if already.get('state') != 'running':
-            import time as _tm
-            total_syms = len(scan_symbols)
-            _cp.set(cache_key, {'state': 'running', 'progress': 0, 'total': total_syms, 'phase': 'เริ่มสแกน…', 'timestamp': _tm.time()}, timeout=900)
+        _start_scan_thread(cache_key, request.user.id, run_momentum_scan, market.code, 'เริ่มสแกน…')
+        return redirect(page['url_name'])
 
-            def _run_momentum_bg(uid, ckey, sym_list):
-                try:
-                    import numpy as _np
-                    import pandas as _pd
-                    import pandas_ta as _ta
-                    import yfinance as _yf
-                    from django.contrib.auth import get_user_model
-                    from django.core.cache import cache as _c
-
-                    from stocks.models import MomentumCandidate as _MC
-                    from stocks.utils import (
-                        analyze_momentum_technical,
-                        find_supply_demand_zones,
-                    )
-                    from stocks.utils import get_top_ranked_symbols as _GTRS
-                    User = get_user_model()
-                    user = User.objects.get(pk=uid)
-                    
-                    sym_list = _GTRS(market='SET', limit=300, auto_refresh=True)
-                    _MC.objects.filter(user=user, market='SET').delete()
-                    
-                    # --- STAGE 1: Fast Screening (The Radar) ---
-                    # Scan all 800+ symbols for basic liquidity and trend
-                    total_syms = len(sym_list)
-                    _c.set(ckey, {'state': 'running', 'progress': 5, 'total': total_syms, 'phase': f'Stage 1: สแกนด่วน {total_syms} ตัว...'}, timeout=900)
-                    
-                    # Align dates with Precision scanner for better data consistency
-                    from datetime import datetime as _dt
-                    from datetime import timedelta as _td
-
-                    import pytz as _pytz
-                    _bkk_tz = _pytz.timezone('Asia/Bangkok')
-                    _now_bkk = _dt.now(_bkk_tz)
-                    scan_end_date  = _now_bkk.date() + _td(days=1)
-                    scan_end_str   = scan_end_date.strftime('%Y-%m-%d')
-                    scan_start_str = (_now_bkk.date() - _td(days=600)).strftime('%Y-%m-%d')
-                    
-                    # --- STAGE 1: Fast Screening (Turbo Chunks) ---
-                    from yahooquery import Ticker as _TQ
-                    _c.set(ckey, {'state': 'running', 'progress': 5, 'total': total_syms, 'phase': 'Stage 1: 🔎 Fast Screening...'}, timeout=900)
-                    
-                    candidates = []
-                    chunk_size = 100
-                    for i in range(0, total_syms, chunk_size):
-                        chunk = sym_list[i : i + chunk_size]
-                        chunk_bk = [f"{s}.BK" for s in chunk]
-                        _c.set(ckey, {'state': 'running', 'progress': 5 + int((i/total_syms)*15), 'total': total_syms, 'phase': f'Phase 1: กรองราคาด่วน {i}/{total_syms}...'}, timeout=600)
-                        try:
-                            tq = _TQ(chunk_bk, timeout=60)
-                            prices = tq.price
-                            for symbol in chunk:
-                                try:
-                                    s_bk = f"{symbol}.BK"
-                                    if not isinstance(prices, dict) or s_bk not in prices:
-                                        candidates.append({'symbol': symbol}); continue
-                                    
-                                    p_data = prices.get(s_bk)
-                                    if not isinstance(p_data, dict) or 'regularMarketPrice' not in p_data:
-                                        candidates.append({'symbol': symbol}); continue
-                                    
-                                    curr_p = p_data.get('regularMarketPrice')
-                                    avg_vol = p_data.get('averageDailyVolume3Month', 0)
-                                    # Very loose liquidity filter to ensure we get results
-                                    if (curr_p * avg_vol) < 150000: continue
-                                    candidates.append({'symbol': symbol})
-                                except Exception: candidates.append({'symbol': symbol})
-                        except Exception:
-                            for sym in chunk: candidates.append({'symbol': sym})
+    # --- Markov Market Regime Pulse ---
+    regime = None
+    if page['regime_index']:
+        from django.core.cache import cache
 
-                    if len(candidates) < 20: # Emergency fallback
-                        candidates = [{'symbol': s} for s in sym_list[:150]]
-                        
-                    # --- STAGE 2: Deep Technical Analysis (Multi-threaded Turbo) ---
-                    total_cand = len(candidates)
-                    pre_results = []
-                    _c.set(ckey, {'state': 'running', 'progress': 20, 'total': total_cand, 'phase': f'Stage 2: Technical Scan ({total_cand})...'}, timeout=900)
-                    
-                    import concurrent.futures as _cf
-                    def _analyze_one(symbol):
-                        try:
-                            s_bk = f"{symbol}.BK"
-                            # ใช้ yf.Ticker().history() แทน yf.download() — yf.download() มีบั๊ก
-                            # thread-safety ทำให้ข้อมูลปนข้าม symbol เมื่อรันใน ThreadPool
-                            # (บั๊กเดียวกับที่เคยแก้ใน Precision scanner แล้ว)
-                            df = _yf.Ticker(s_bk).history(period="1y", interval="1d", timeout=20)
-                            if df is None or df.empty or len(df) < 55: return None
-                            if isinstance(df.columns, pd.MultiIndex): df.columns = df.columns.droplevel(1)
-                            
-                            df['EMA50'] = _ta.ema(df['Close'], length=50)
-                            df['EMA200'] = _ta.ema(df['Close'], length=200)
-                            df['RSI'] = _ta.rsi(df['Close'], length=14)
-                            adx = _ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                            if adx is not None: df = pd.concat([df, adx], axis=1)
-                            df['MFI'] = _ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
-                            
-                            tech = analyze_momentum_technical_v2(df)
-                            if tech.get('rsi', 0) < 35: return None 
-                            
-                            return {
-                                'symbol': symbol, 'df': df, 'tech': tech,
-                                'price': float(df['Close'].iloc[-1]),
-                                'year_high': float(df['High'].tail(252).max()),
-                                'sd_zone': find_supply_demand_zones(df)
-                            }
-                        except Exception: return None
-
-                    # Run Stage 2 in parallel for speed
-                    with _cf.ThreadPoolExecutor(max_workers=15) as executor:
-                        futs = {executor.submit(_analyze_one, c['symbol']): c['symbol'] for c in candidates[:150]}
-                        done = 0
-                        for fut in _cf.as_completed(futs):
-                            done += 1
-                            if done % 10 == 0:
-                                _c.set(ckey, {'state': 'running', 'progress': 20 + int((done/150)*65), 'phase': f'Analyzing {done}/150...'}, timeout=600)
-                            
-                            res = None
-                            try:
-                                res = fut.result(timeout=25)
-                            except Exception: pass
-                            
-                            # FALLBACK: If Threaded yfinance fails, try ONE last Sync check with YahooQuery for this symbol
-                            if not res:
-                                symbol = futs[fut]
-                                try:
-                                    s_bk = f"{symbol}.BK"
-                                    tq_single = _TQ(s_bk)
-                                    h = tq_single.history(period='1y', interval='1d')
-                                    if h is not None and not h.empty:
-                                        if isinstance(h.index, pd.MultiIndex): h = h.xs(s_bk, level=0)
-                                        # Minimal data requirement reduced to 40
-                                        if len(h) >= 40:
-                                            h.rename(columns={'adjclose': 'Close', 'high': 'High', 'low': 'Low', 'open': 'Open', 'volume': 'Volume'}, inplace=True)
-                                            h['EMA50'] = _ta.ema(h['Close'], length=50)
-                                            h['EMA200'] = _ta.ema(h['Close'], length=min(200, len(h)-1))
-                                            h['RSI'] = _ta.rsi(h['Close'], length=14)
-                                            # ADX/MFI ต้องคำนวณใน fallback ด้วย ไม่งั้นตัวที่มาทางนี้ได้ 0 เสมอ
-                                            try:
-                                                _adx_fb = _ta.adx(h['High'], h['Low'], h['Close'], length=14)
-                                                if _adx_fb is not None: h = pd.concat([h, _adx_fb], axis=1)
-                                                h['MFI'] = _ta.mfi(h['High'], h['Low'], h['Close'], h['Volume'], length=14)
-                                            except Exception: pass
-                                            tech = analyze_momentum_technical_v2(h)
-                                            if tech.get('rsi', 0) > 30: 
-                                                 res = {
-                                                    'symbol': symbol, 'df': h, 'tech': tech,
-                                                    'price': float(h['Close'].iloc[-1]),
-                                                    'year_high': float(h['High'].tail(252).max()),
-                                                    'sd_zone': find_supply_demand_zones(h)
-                                                }
-                                except Exception: pass
-                                
-                            if res: pre_results.append(res)
-
-                    # --- STAGE 3: Bulk Fundamental ---
-                    fund_data = {}
-                    if pre_results:
-                        _c.set(ckey, {'state': 'running', 'progress': 85, 'phase': 'Stage 3: Fundamental...'}, timeout=900)
-                        from stocks.utils import YQTicker
-                        match_bk = [f"{r['symbol']}.BK" for r in pre_results]
-                        try:
-                            yq_all = YQTicker(match_bk)
-                            modules = yq_all.get_modules('financialData summaryProfile defaultKeyStatistics')
-                            for s_bk, val in modules.items():
-                                if not isinstance(val, dict): continue
-                                sym_clean = s_bk.replace('.BK','')
-                                prof = val.get('summaryProfile', {})
-                                fin  = val.get('financialData', {})
-                                keystat = val.get('defaultKeyStatistics', {})
-                                eps_g = keystat.get('earningsQuarterlyGrowth') or fin.get('earningsGrowth') or 0.0
-                                fund_data[sym_clean] = {
-                                    'sector': prof.get('sector', 'Other'),
-                                    'eps_growth': float(eps_g) * 100,
-                                    'rev_growth': float(fin.get('revenueGrowth', 0) or 0) * 100
-                                }
-                        except Exception as _fx:
-                            import logging; logging.getLogger('stocks').warning(f"[Momentum] Stage 3 fundamental fetch failed: {_fx}")
-
-                    # ── RS Rating: rank ผลตอบแทน 3 เดือน (66 วัน) แบบเดียวกับ Precision scanner ──
-                    # หมายเหตุ: rank ภายในกลุ่มผู้รอด Stage 2 (~150 ตัวใหญ่) ไม่ใช่ทั้งตลาด
-                    _rs_returns = {}
-                    for r in pre_results:
-                        try:
-                            _cl = r['df']['Close'].dropna()
-                            if len(_cl) >= 66:
-                                _rs_returns[r['symbol']] = float((_cl.iloc[-1] - _cl.iloc[-66]) / abs(_cl.iloc[-66]) * 100)
-                        except Exception:
-                            continue
-                    _rs_map = {}
-                    if _rs_returns:
-                        _rs_ser = _pd.Series(_rs_returns)
-                        _rs_map = (_rs_ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                    # FINAL: Save to DB
-                    _c.set(ckey, {'state': 'running', 'progress': 95, 'phase': 'Saving results...'}, timeout=600)
-                    bulk_objs = []
-                    for r in pre_results:
-                        sym = r['symbol']
-                        sd  = r['sd_zone']
-                        tech = r['tech']
-                        df = r['df']
-                        f   = fund_data.get(sym, {'sector': 'N/A', 'eps_growth': 0.0, 'rev_growth': 0.0})
-                        
-                        dz_start = dz_end = sz_start = sz_end = sl_price = rr_val = None
-                        entry_strat = ''
-                        if sd:
-                            entry_strat = sd['type']; dz_start = sd['start']; dz_end = sd['end']
-                            sz_start = sd['target']; sz_end = sd['target'] * 1.02
-                            sl_price = sd['stop_loss']; rr_val = sd['rr_ratio']
-
-                        bulk_objs.append(_MC(
-                            user=user, symbol=sym, symbol_bk=f"{sym}.BK", market='SET', price=r['price'],
-                            rsi=tech.get('rsi', 0), 
-                            adx=float(df['ADX_14'].iloc[-1]) if 'ADX_14' in df.columns else 0,
-                            mfi=float(df['MFI'].iloc[-1]) if 'MFI' in df.columns else 0,
-                            rvol=tech.get('rvol', 0), 
-                            rvol_bullish=tech.get('rvol_bullish', False),
-                            technical_score=tech.get('score', 0),
-                            rs_rating=_rs_map.get(sym, 0),
-                            entry_strategy=entry_strat, 
-                            demand_zone_start=dz_start, 
-                            demand_zone_end=dz_end,
-                            supply_zone_start=sz_start, 
-                            supply_zone_end=sz_end, 
-                            stop_loss=sl_price, 
-                            risk_reward_ratio=rr_val,
-                            year_high=r['year_high'], 
-                            upside_to_high=((r['year_high'] - r['price'])/r['price'])*100 if r['price'] > 0 else 0,
-                            sector=f['sector'], 
-                            eps_growth=f['eps_growth'], 
-                            rev_growth=f['rev_growth'],
-                            stage2=r['price'] > float(df['EMA200'].iloc[-1]) if 'EMA200' in df.columns else False
-                        ))
-                    if bulk_objs:
-                        _MC.objects.bulk_create(bulk_objs)
-                except Exception as e:
-                    import logging; logging.getLogger('stocks').error(f"Momentum Scan Error: {e}")
-                finally:
-                    _c.set(ckey, {'state': 'done', 'progress': 100, 'total': total_syms, 'phase': 'เสร็จสิ้น'}, timeout=120)
-
-            # Start Worker
-            _th.Thread(target=_run_momentum_bg, args=(user_id, cache_key, scan_symbols), daemon=True).start()
-
-    # ====== Handle AI Summary Analysis (Optional) ======
-    ai_analysis = ""
-    if request.GET.get('analyze') == 'true':
-        try:
-            data_to_analyze = []
-            top_best = MomentumCandidate.objects.filter(user=request.user, market='SET').order_by('-technical_score')[:15]
-            for t in top_best:
-                data_to_analyze.append({
-                    'symbol': t.symbol, 'score': t.technical_score, 'rvol': t.rvol, 'rsi': t.rsi,
-                    'eps_growth': t.eps_growth, 'rev_growth': t.rev_growth, 'upside': t.upside_to_high
-                })
-            
-            if data_to_analyze:
-                prompt = f"หุ้นไทย Momentum แรงที่สุด 15 ตัวจากระบบสแกน: {json.dumps(data_to_analyze)}\nช่วยวิเคราะห์และคัดเลือก 3-5 ตัวที่น่าสนใจที่สุด พร้อมเหตุผลเชิงกลยุทธ์ตามสไตล์ Mark Minervini และบอกจุดระวัง"
-                ai_analysis = analyze_with_ai(prompt)
-        except Exception as e:
-            ai_analysis = f"AI Analysis Error: {str(e)}"
+        from stocks.utils import calculate_markov_regime
+        regime_cache_key = f'markov_regime_{market.code}'
+        regime = cache.get(regime_cache_key)
+        if not regime:
+            regime = calculate_markov_regime(page['regime_index'])
+            cache.set(regime_cache_key, regime, timeout=1800)
 
-    # ป้องกัน FieldError จาก ?sort= ค่าที่ไม่มีในฐานข้อมูล
-    _MOMENTUM_SORT_MAP = {
-        'score':          '-technical_score',
-        'technical_score':'-technical_score',
-        'price':          '-price',
-        'rsi':            '-rsi',
-        'rvol':           '-rvol',
-        'rs':             '-rs_rating',
-        'rs_rating':      '-rs_rating',
-        'symbol':         'symbol',
-        'adx':            '-adx',
-        'upside':         '-upside_to_high',
-    }
-    raw_sort   = request.GET.get('sort', '-technical_score')
-    sort_by    = _MOMENTUM_SORT_MAP.get(raw_sort, raw_sort if raw_sort.lstrip('-') in {
-        'technical_score','price','rsi','rvol','rs_rating','symbol','adx','upside_to_high','mfi'
-    } else '-technical_score')
-    candidates = MomentumCandidate.objects.filter(user=request.user, market='SET').order_by(sort_by)
-    scanned_at = candidates.first().scanned_at if candidates.exists() else None
+    sort_by = request.GET.get('sort', 'score')
+    order_field = _MOMENTUM_SORTS.get(sort_by, '-technical_score')
 
     # ตรวจว่ากำลังสแกนอยู่ - ถ้าใช่ ซ่อน results เพื่อไม่ให้กระพริบ
-    _scan_state = _cp.get(cache_key, {})
-    is_scanning = _scan_state.get('state') == 'running'
-
+    is_scanning = _scan_jobs.get(cache_key, {}).get('state') == 'running'
+    candidates = MomentumCandidate.objects.filter(user=request.user, market=market.code).order_by(order_field)
     candidate_list = list(candidates) if not is_scanning else []
+    scanned_at = max((c.scanned_at for c in candidate_list), default=None)
 
-    # ====== Live Price + Fresh Zone - recompute zone จาก historical data ใหม่ทุกครั้ง ======
     if candidate_list:
+        # ====== Live Price + Fresh Zone — ใช้แสดงผลเท่านั้น ไม่เขียนกลับ DB ======
+        live_map, prev_close_map = {}, {}
         try:
-            import concurrent.futures as _mcf
-            from datetime import datetime as _mdt
-            from datetime import time as _mtime
-            from datetime import timedelta as _mtd
-
-            # คำนวณ end date เหมือน entry_finder - ห้ามรวม today's incomplete bar ตอนตลาดเปิด
-            import pytz as _mpytz
-            _mnow   = _mdt.now(_mpytz.timezone('Asia/Bangkok'))
-            _mt     = _mnow.time()
-            _market_open_now = (
-                _mnow.weekday() < 5 and
-                (
-                    _mt < _mtime(10, 0) or
-                    (_mtime(10, 0) <= _mt <= _mtime(12, 30)) or
-                    (_mtime(12, 30) < _mt < _mtime(14, 30)) or
-                    (_mtime(14, 30) <= _mt <= _mtime(16, 30))
-                )
-            )
-            _mend_date  = (_mnow.date() - _mtd(days=1)) if _market_open_now else _mnow.date()
-            _mend_str   = _mend_date.strftime('%Y-%m-%d')
-            _mstart_str = (_mend_date - _mtd(days=600)).strftime('%Y-%m-%d')
-
-            def _mom_live(arg):
-                sym, mkt = arg
-                try:
-                    full_sym = f"{sym}.BK" if mkt == 'SET' else sym
-                    fi = yf.Ticker(full_sym).fast_info
-                    p = getattr(fi, 'last_price', None)
-                    pc = getattr(fi, 'regular_market_previous_close', getattr(fi, 'previous_close', None))
-                    live_price = float(p) if p else None
-                    prev_close = float(pc) if pc else None
-
-                    # Recompute zone - ใช้ Ticker().history() (thread-safe), end date เหมือน entry_finder
-                    _t = yf.Ticker(full_sym)
-                    df = _t.history(start=_mstart_str, end=_mend_str, interval='1d')
-                    fresh_zone = None
-                    if df is not None and len(df) >= 50:
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.get_level_values(0)
-                        fresh_zone = find_supply_demand_zones_v2(df)
-                    return sym, live_price, fresh_zone, prev_close
-                except Exception:
-                    return sym, None, None, None
-
-            live_map = {}
-            zone_map = {}   # fresh zones - keyed by symbol
-            prev_close_map = {}
-            with _mcf.ThreadPoolExecutor(max_workers=6) as _mex:
-                for _s, _p, _z, _pc in _mex.map(_mom_live, [(c.symbol, c.market) for c in candidate_list]):
-                    if _p: live_map[_s] = _p
-                    if _z: zone_map[_s] = _z
-                    if _pc: prev_close_map[_s] = _pc
+            from stocks.quote_service import get_quotes
+            keys = {c.symbol: market.yahoo(c.symbol) for c in candidate_list}
+            quotes = get_quotes(list(keys.values()))
+            for sym, key in keys.items():
+                q = quotes.get(key) or {}
+                if q.get('price'):
+                    live_map[sym] = q['price']
+                if q.get('prev_close'):
+                    prev_close_map[sym] = q['prev_close']
         except Exception:
-            live_map = {}
-            zone_map = {}
-            prev_close_map = {}
-
-        for c in candidate_list:
-            lp  = live_map.get(c.symbol)
-            pc  = prev_close_map.get(c.symbol) or float(c.price or 0)
-            c.live_price = lp
-            ref = lp if lp else float(c.price or 0)
-
-            # ใช้ fresh zone ถ้ามี มิฉะนั้น fallback ไป DB zone
-            fz = zone_map.get(c.symbol)
-            if fz:
-                dz_s = float(fz.get('start') or 0)
-                dz_e = float(fz.get('end')   or 0)
-                sz_s = float(fz.get('target') or 0)
-                # อัปเดต zone ใน candidate object ด้วย เพื่อให้ template แสดงถูก
-                c.demand_zone_start = dz_s or c.demand_zone_start
-                c.demand_zone_end   = dz_e or c.demand_zone_end
-                c.supply_zone_start = sz_s or c.supply_zone_start
-            else:
-                dz_s = float(c.demand_zone_start or 0)
-                dz_e = float(c.demand_zone_end   or 0)
-                sz_s = float(c.supply_zone_start or 0)
-
-            # zone status ตาม live price + fresh zone
-            c.live_in_zone    = dz_s > 0 and dz_e > 0 and dz_e <= ref <= dz_s
-            c.live_broke_zone = dz_e > 0 and ref < dz_e
-            c.live_above_tp   = sz_s > 0 and ref >= sz_s
-            c.live_near_tp    = (not c.live_above_tp) and sz_s > 0 and dz_s > 0 and (sz_s - ref) / (sz_s - dz_s) * 100 <= 15 if (sz_s - dz_s) > 0 else False
-            c.live_zone_prox  = 0.0 if ref <= dz_s else round((ref - dz_s) / dz_s * 100, 1) if dz_s > 0 else 999
-            if lp and pc > 0:
-                c.live_change_pct = round((lp - pc) / pc * 100, 2)
-            else:
-                c.live_change_pct = None
-
-    # ── Top Picks: คัดอัตโนมัติ 4 ด่าน (พื้นฐาน → RSI → แรง → จัดลำดับ) ──
-    top_picks = []
-    if candidate_list:
-        _pool = []
-        for c in candidate_list:
-            eps  = float(c.eps_growth or 0)
-            rev  = float(c.rev_growth or 0)
-            rsi  = float(c.rsi or 0)
-            adx  = float(c.adx or 0)
-            # ด่าน 1: พื้นฐานต้องโตจริงอย่างน้อยหนึ่งด้าน (EPS หรือ Revenue ≥ 10%)
-            if eps < 10 and rev < 10:
-                continue
-            # ด่าน 1.5: Revenue ห้ามติดลบ — EPS โตแต่รายได้หด = กำไรจากรายการพิเศษ/ฐานต่ำ ไม่ใช่ธุรกิจโต
-            if rev < 0:
-                continue
-            # ด่าน 2: ตัดของร้อนจัด (RSI ≥ 80 ไล่ไม่ได้ ถือก็เสียว)
-            if rsi >= 80:
-                continue
-            # ด่าน 3: ต้องมีแรงขับ (ADX ≥ 20 — ถ้าไม่มีข้อมูล ADX ให้ผ่าน)
-            if adx and adx < 20:
-                continue
-            _pool.append(c)
-        # ด่าน 4: เรียงคุณภาพ (EPS+REV) → ความคุ้ม (RR) → ความสด (RVOL)
-        _pool.sort(key=lambda c: (
-            float(c.eps_growth or 0) + float(c.rev_growth or 0),
-            float(c.risk_reward_ratio or 0),
-            float(c.rvol or 0)
-        ), reverse=True)
-
-        for c in _pool[:7]:
-            rsi  = float(c.rsi or 0)
-            rvol = float(c.rvol or 0)
-            dz_s = float(c.demand_zone_start or 0)
-            dz_e = float(c.demand_zone_end or 0)
-            zone_txt = f"{dz_e:.2f}–{dz_s:.2f}" if dz_s > 0 else "-"
-            if getattr(c, 'live_in_zone', False):
-                status, action = 'enter', f'อยู่ในโซนซื้อ {zone_txt} — เข้าได้ (เช็ค Precision ก่อนกด)'
-            elif getattr(c, 'live_above_tp', False):
-                status, action = 'skip', 'ถึง TP แล้ว — ห้ามไล่ รอสร้างฐานใหม่'
-            elif rsi >= 75:
-                status, action = 'wait', f'RSI {rsi:.0f} ร้อน — รอย่อเข้าโซน {zone_txt}'
-            elif rvol < 0.8:
-                status, action = 'wait', f'Volume ยังหลับ ({rvol:.1f}x) — ตั้ง alert โซน {zone_txt}'
-            elif getattr(c, 'live_near_tp', False):
-                status, action = 'wait', f'ใกล้ TP เหลือ upside น้อย — รอย่อโซน {zone_txt}'
-            else:
-                status, action = 'alert', f'ตั้ง alert โซนซื้อ {zone_txt}'
-            _lp = getattr(c, 'live_price', None)
-            top_picks.append({
-                'symbol': c.symbol,
-                'price': float(_lp) if _lp else float(c.price or 0),
-                'change_pct': getattr(c, 'live_change_pct', None),
-                'eps': float(c.eps_growth or 0),
-                'rev': float(c.rev_growth or 0),
-                'rr': float(c.risk_reward_ratio or 0),
-                'rvol': rvol,
-                'rsi': rsi,
-                'status': status,
-                'action': action,
-            })
-
-    # ── Let Profit Run ─────────────────────────────────────────────────
-    # แสดง badge เมื่อหุ้นในพอร์ตล็อกกำไรบางส่วนไปแล้วและกำลังเทรลราคาส่วนที่เหลือ (tp1_hit=True)
-    from stocks.models import Portfolio as _PortfolioMomSET
-    from stocks.utils import simple_trailing_stop
-    trailing_status = {}
-    for p in _PortfolioMomSET.objects.filter(user=request.user, market='SET', tp1_hit=True):
-        ep = float(p.entry_price or 0)
-        trail_stop = simple_trailing_stop(p.highest_price, p.atr, p.trail_multiplier)
-        gain_pct = ((float(p.highest_price or 0) - ep) / ep * 100) if ep > 0 and p.highest_price else None
-        trailing_status[p.symbol.split('.')[0].upper()] = {
-            'trail_stop': trail_stop,
-            'tp1_price': p.tp1_price,
-            'gain_pct': gain_pct,
-        }
+            pass
+        if page['fresh_zones']:
+            try:
+                zone_map = _momentum_fresh_zones(candidate_list, market)
+            except Exception:
+                zone_map = {}
+            for c in candidate_list:
+                fz = zone_map.get(c.symbol)
+                if fz:
+                    # ใช้ fresh zone ถ้ามี มิฉะนั้นคง zone จาก DB
+                    c.demand_zone_start = float(fz.get('start') or 0) or c.demand_zone_start
+                    c.demand_zone_end = float(fz.get('end') or 0) or c.demand_zone_end
+                    c.supply_zone_start = float(fz.get('target') or 0) or c.supply_zone_start
+        _attach_live_status(candidate_list, live_map, prev_close_map)
+
+    # ====== AI Summary Analysis (Optional) ======
+    ai_analysis = None
+    if candidate_list and request.GET.get('analyze') == 'true':
+        try:
+            ai_analysis = page['ai'](request, candidate_list)
+        except Exception as e:
+            ai_analysis = f"AI Analysis Error: {str(e)}"
 
     context = {
-        'title': 'Global Momentum Scanner (CAN SLIM)',
+        'title': page['title'],
         'candidates': candidate_list,
         'ai_analysis': ai_analysis,
         'scanned_at': scanned_at,
         'current_sort': sort_by,
         'is_scanning': is_scanning,
-        'has_scanned': bool(candidate_list) or (candidates.exists() and not is_scanning),
+        'has_scanned': is_scanning or bool(candidate_list),
         'market_regime': regime,
-        'top_picks': top_picks,
-        'trailing_status': trailing_status,
+        # Top Picks คัดจาก EPS/Revenue growth — มีเฉพาะตลาดที่ pipeline ดึงข้อมูลพื้นฐาน
+        'top_picks': _momentum_top_picks(candidate_list) if RULES[market.code].with_fundamentals else [],
+        'trailing_status': _trailing_status(request.user, market),
     }
-    return render(request, 'stocks/momentum.html', context)
+    return render(request, page['template'], context)
+
+
+# ============================================================
+# ฟังก์ชัน: momentum_scanner
+# วัตถุประสงค์: สแกนหาหุ้นที่มี Momentum แข็งแกร่ง (SET Market)
+#   วิเคราะห์ปัจจัย: RS Score, Volume Surge, Price Action,
+#   Trend Alignment และ Market Regime เพื่อคัดกรองหุ้นแนวโน้มขาขึ้น
+# ============================================================
+@login_required
+def momentum_scanner(request):
+    """
+    Globally scans SET100 roughly matching Mark Minervini Trend Template.
+    Runs in a background thread to avoid 504 timeout.
+    """
+    return _momentum_scanner_view(request, 'SET')
 
 
 # ====== Market Condition Analyzer - วิเคราะห์สภาวะตลาด SET Index ======
@@ -1532,64 +1053,70 @@ def mm_manual(request):
     return render(request, 'stocks/mm_manual.html')
 
 
-# ============================================================
-# ฟังก์ชัน: minervini_sepa_scanner
-# วัตถุประสงค์: สแกนหุ้นตามระบบ Minervini SEPA
-#   (Specific Entry Point Analysis) — กลยุทธ์จาก Mark Minervini
-#   เกณฑ์: หุ้นอยู่ใน Trend Template, VCP Pattern, RS > 70
-#   และราคาอยู่ใกล้ Pivot Point เหมาะสำหรับ Growth Stock
-# ============================================================
-@login_required
-def minervini_sepa_scanner(request):
+# หน้าของ SEPA Scanner แต่ละตลาด — ตารางที่อ่าน / สแกนที่ต้องรัน อยู่ใน stocks.sepa_scan.RULES
+_SEPA_PAGES = {
+    'SET': {'template': 'stocks/sepa_scanner.html', 'url_name': 'stocks:minervini_sepa_scanner'},
+    'US': {'template': 'stocks/us_sepa_scanner.html', 'url_name': 'stocks:us_sepa_scanner'},
+}
+
+
+def _sepa_scanner_view(request, market_code):
     """
-    Minervini SEPA Scanner - ระบบสแกนเจาะจงเฉพาะตามตำรา Mark Minervini
-    กรองเฉพาะหุ้นที่อยู่ใน Stage 2 และมีฟอร์ม VCP/VDU
+    เนื้อหาร่วมของ minervini_sepa_scanner (SET) และ us_sepa_scanner (US)
+    POST หรือ ?scan=true → รันสแกนของตลาดนั้น (SepaRules.run_scan) ใน background thread
+    GET → หุ้น Stage 2 + RS ≥ SepaRules.min_rs ของรอบที่เลือก (?run_idx=) เรียงตาม SEPA Score
     """
-    # ดึงรายชื่อรอบการสแกน (ใช้จาก PrecisionScanCandidate)
-    all_runs = list(
-        PrecisionScanCandidate.objects
-        .filter(user=request.user, market='SET')
-        .values_list('scan_run', flat=True)
-        .order_by('-scan_run')
-        .distinct()
-    )
-    
+    from stocks.models import ScanWatchlistItem
+    from stocks.scan_pipeline import MARKETS
+    from stocks.sepa_scan import RULES
+
+    market = MARKETS[market_code]
+    rules = RULES[market_code]
+    page = _SEPA_PAGES[market_code]
+    cache_key = f'{rules.job}_{request.user.id}'
+
+    if request.GET.get('scan_status') == '1':
+        return _scan_status_response(cache_key)
+
+    if request.method == 'POST' or request.GET.get('scan') == 'true':
+        _start_scan_thread(cache_key, request.user.id, rules.run_scan, market.code, 'เริ่มสแกน SEPA…')
+        return redirect(page['url_name'])
+
+    # ── Display ────────────────────────────────────────────────────
+    rows = rules.candidates(request.user, market.code)
+    all_runs = list(rows.values_list('scan_run', flat=True).distinct().order_by('-scan_run'))
+    try:
+        run_idx = max(0, min(int(request.GET.get('run_idx', 0)), len(all_runs) - 1)) if all_runs else 0
+    except (ValueError, TypeError):
+        run_idx = 0
+
     candidates = []
     last_updated = None
-    selected_run_idx = int(request.GET.get('run_idx', 0))
-
     if all_runs:
-        if selected_run_idx < len(all_runs):
-            run_time = all_runs[selected_run_idx]
-            # กรองเฉพาะ Stage 2 + RS Rating >= 70 (ตาม SEPA criteria)
-            candidates = list(PrecisionScanCandidate.objects.filter(
-                user=request.user,
-                scan_run=run_time,
-                stage2=True,
-                rs_rating__gte=70,
-            ).order_by('-vcp_setup', '-rs_rating'))
-            last_updated = run_time
-
-    # เพิ่มเติม: กรองเฉพาะตัวที่มีสัญญาณ VCP เพื่อความ Clean
-    vcp_only = request.GET.get('vcp_only') == '1'
+        last_updated = all_runs[run_idx]
+        # กรองเฉพาะ Stage 2 + RS Rating ขั้นต่ำ (ตาม SEPA criteria)
+        candidates = list(rows.filter(
+            scan_run=last_updated, stage2=True, rs_rating__gte=rules.min_rs,
+        ).order_by('-vcp_setup', '-rs_rating'))
+
+    # Filters
+    vcp_only        = request.GET.get('vcp_only') == '1'
+    hide_at_tp      = request.GET.get('hide_at_tp', '1') == '1'
+    earnings_filter = request.GET.get('earnings_filter') == '1'
+
+    # vcp_only: เฉพาะตัวที่มีสัญญาณ VCP / hide_at_tp: ซ่อนหุ้นที่ราคาใกล้/ถึง Target (upside_to_high < 10%)
     if vcp_only:
         candidates = [c for c in candidates if c.vcp_setup]
-
-    # hide_at_tp: ซ่อนหุ้นที่ราคาอยู่ใกล้/ถึง Target (upside_to_high < 10%)
-    hide_at_tp = request.GET.get('hide_at_tp', '1') == '1'
     if hide_at_tp:
         candidates = [c for c in candidates if c.upside_to_high >= 10.0]
-
-    # earnings_filter: กรองเฉพาะหุ้นที่ผ่านเกณฑ์ Minervini Earnings (EPS ≥ 25% หรือ Rev ≥ 25%)
-    earnings_filter = request.GET.get('earnings_filter') == '1'
+    # earnings_filter: ผ่านเกณฑ์ Minervini Earnings (EPS ≥ 25% หรือ Rev ≥ 25%)
     if earnings_filter:
-        candidates = [c for c in candidates if (getattr(c, 'eps_growth', 0) or 0) >= 25 or (getattr(c, 'rev_growth', 0) or 0) >= 25]
+        candidates = [c for c in candidates if (c.eps_growth or 0) >= 25 or (c.rev_growth or 0) >= 25]
 
-    # คำนวณ field เพิ่มเติมสำหรับแสดงผล + SEPA Score
+    # Computed display fields + SEPA Score
     for c in candidates:
         # % ห่างจาก Pivot (52w High)
         c.dist_from_pivot = round(c.upside_to_high, 1)
-        # สถานะ TP
         if c.upside_to_high < 5:
             c.tp_status = 'at_tp'
         elif c.upside_to_high < 10:
@@ -1598,12 +1125,11 @@ def minervini_sepa_scanner(request):
             c.tp_status = None
 
         # Earnings badge helper attrs
-        eps_g = getattr(c, 'eps_growth', 0.0) or 0.0
-        rev_g = getattr(c, 'rev_growth', 0.0) or 0.0
+        eps_g = c.eps_growth or 0.0
+        rev_g = c.rev_growth or 0.0
         c.eps_badge = 'strong' if eps_g >= 50 else ('pass' if eps_g >= 25 else ('warn' if eps_g >= 0 else 'fail'))
         c.rev_badge = 'strong' if rev_g >= 50 else ('pass' if rev_g >= 25 else ('warn' if rev_g >= 0 else 'fail'))
 
-        # SEPA Score (รวม Earnings bonus)
         sc = 0
         if c.vcp_setup:
             sc += 30
@@ -1631,926 +1157,114 @@ def minervini_sepa_scanner(request):
         elif eps_g >= 10: sc += 5
         if rev_g >= 50:  sc += 10
         elif rev_g >= 25: sc += 6
+        # ROE / EPS acceleration มีเฉพาะตลาดที่สแกนดึงงบมาเอง (SepaRules.has_earnings)
+        if rules.has_earnings:
+            roe_v = c.roe or 0.0
+            c.roe_badge = 'pass' if roe_v >= 17 else 'warn'
+            if roe_v >= 17:   sc += 8
+            elif roe_v >= 10: sc += 3
+            if c.eps_accel: sc += 10
         c.sepa_score = sc
 
-    # Sort by SEPA Score descending
+    # Sort by SEPA Score descending แล้วให้อันดับ
     candidates.sort(key=lambda c: c.sepa_score, reverse=True)
-
-    # Assign rank
     for i, c in enumerate(candidates, 1):
         c.sepa_rank = i
 
     context = {
-        'candidates': candidates,
-        'last_updated': last_updated,
-        'all_runs': all_runs,
-        'selected_run_idx': selected_run_idx,
-        'vcp_only': vcp_only,
-        'hide_at_tp': hide_at_tp,
-        'earnings_filter': earnings_filter,
+        'candidates':       candidates,
+        'last_updated':     last_updated,
+        'all_runs':         all_runs,
+        'selected_run_idx': run_idx,
+        'vcp_only':         vcp_only,
+        'hide_at_tp':       hide_at_tp,
+        'earnings_filter':  earnings_filter,
+        'watchlist_symbols': set(
+            ScanWatchlistItem.objects.filter(user=request.user, market=market.code).values_list('symbol', flat=True)
+        ),
     }
-    return render(request, 'stocks/sepa_scanner.html', context)
-
+    return render(request, page['template'], context)
 # ============================================================
-# ฟังก์ชัน: precision_momentum_scanner
-# วัตถุประสงค์: ระบบสแกน Precision Momentum (ฟีเจอร์หลักของระบบ)
-#   ใช้อัลกอริทึมหลายชั้นในการคัดกรองหุ้น:
-#     1. Market Regime Detection (BULL/BEAR/CHOPPY)
-#     2. Multi-timeframe Trend Alignment
-#     3. Momentum Score & RS Ranking
-#     4. Volume Confirmation
-#     5. Risk/Reward Calculation
-#   ใช้ Cache, Background Thread และ Database เพื่อประสิทธิภาพสูงสุด
+# ฟังก์ชัน: minervini_sepa_scanner
+# วัตถุประสงค์: สแกนหุ้นตามระบบ Minervini SEPA
+#   (Specific Entry Point Analysis) — กลยุทธ์จาก Mark Minervini
+#   เกณฑ์: หุ้นอยู่ใน Trend Template, VCP Pattern, RS > 70
+#   และราคาอยู่ใกล้ Pivot Point เหมาะสำหรับ Growth Stock
 # ============================================================
 @login_required
-def precision_momentum_scanner(request):
+def minervini_sepa_scanner(request):
     """
-    Precision Momentum Scanner - กรองคุณภาพสูงกว่า momentum_scanner
-    ปรับปรุงจาก momentum_scanner:
-    1. ERC ต้องมี Body + Volume > 1.5x avg (ทั้งสองเงื่อนไข)
-    2. ADX >= 20 (กรองเทรนด์แข็งแกร่งเท่านั้น)
-    3. Liquidity filter: avg 20d volume >= 500,000 หุ้น
-    4. Supply target = 52-week high เสมอ
-    5. ATR-based stop loss
-    6. Direction-aware RVOL scoring
-    7. เก็บประวัติ scan 3 รอบล่าสุด
-    8. is_new_entry flag (หุ้นใหม่ vs ยังอยู่จากรอบก่อน)
+    Minervini SEPA Scanner - ระบบสแกนเจาะจงเฉพาะตามตำรา Mark Minervini
+    กรองเฉพาะหุ้นที่อยู่ใน Stage 2 และมีฟอร์ม VCP/VDU
+    """
+    return _sepa_scanner_view(request, 'SET')
+
+
+# หน้า/ชื่อของ Precision Momentum Scanner แต่ละตลาด — ส่วนอื่นทั้งหมดใช้ร่วมกันใน _precision_scanner_view
+_PRECISION_PAGES = {
+    'SET': {'title': 'Precision Momentum Scanner - กรองคุณภาพ', 'template': 'stocks/precision_scan.html',
+            'url_name': 'stocks:precision_momentum_scanner'},
+    'US': {'title': 'US Precision Momentum Scanner - กรองคุณภาพ', 'template': 'stocks/us_precision_scan.html',
+           'url_name': 'stocks:us_precision_scanner'},
+}
+
+
+def _precision_scanner_view(request, market_code):
+    """
+    เนื้อหาร่วมของ precision_momentum_scanner (SET) และ us_precision_scanner (US)
+    POST action=scan → รัน stocks.precision_scan.run_precision_scan ใน background thread
+    GET → แสดงผลรอบสแกนที่เลือก (?run_idx=) พร้อม live price / BUY-SELL score / POC trend
     """
+    from stocks.scan_pipeline import MARKETS
+
+    market = MARKETS[market_code]
+    page = _PRECISION_PAGES[market_code]
+
     # ====== AJAX Status Poll ======
+    # key เดียวกันทั้ง 2 ตลาด — สแกน precision ได้ทีละรอบต่อ user (งาน CPU หนัก ไม่ให้ซ้อนกัน)
     if request.GET.get('scan_status') == '1':
-        from django.core.cache import cache as _cp
         from django.http import JsonResponse as _JR
         _key = f'precision_scan_{request.user.id}'
-        _st = _cp.get(_key, {'state': 'idle'})
+        _st = _scan_jobs.get(_key)
         if _st.get('state') == 'done':
-            _cp.delete(_key)
+            _scan_jobs.clear(_key)
         return _JR(_st)
     from django.utils import timezone as tz
-    from yahooquery import Ticker as YQTicker
-    from stocks.utils import analyze_momentum_technical_v2, get_top_ranked_symbols
+
+    from stocks.utils import get_top_ranked_symbols
 
     # โหลด symbols เบื้องต้นแบบรวดเร็ว (ดึงจาก Cache/DB เดิม) สำหรับใช้ใน context ของ GET request
-    scan_symbols = get_top_ranked_symbols(market='SET', limit=400, auto_refresh=False)
+    scan_symbols = get_top_ranked_symbols(market=market.code, limit=400, auto_refresh=False)
 
     if request.method == "POST" and request.POST.get('action') == 'scan':
         import threading
 
-        from django.core.cache import cache as _cache_bg
+        from stocks.precision_scan import run_precision_scan
 
         user_id   = request.user.id
         cache_key = f'precision_scan_{user_id}'
-        
+
         # เก็บหน้าที่ต้องกลับไปหลังสแกนเสร็จ
         raw_next = request.POST.get('next_url')
-        next_url = 'stocks:minervini_sepa_scanner' if raw_next == 'sepa' else 'stocks:precision_momentum_scanner'
+        next_url = 'stocks:minervini_sepa_scanner' if raw_next == 'sepa' else page['url_name']
 
-        # cache.add() เป็น atomic lock - กัน double-submit เปิด background thread ซ้อนกัน
+        # scan_jobs.start() เป็น atomic lock - กัน double-submit เปิด background thread ซ้อนกัน
+        # (งานค้างจากรอบก่อนที่ done/idle หรือตายไปแล้วจะถูกเขียนทับแล้วสแกนต่อ)
         _init_status = {'state': 'running', 'progress': 0, 'total': 0, 'phase': 'เตรียมข้อมูล…'}
-        if not _cache_bg.add(cache_key, _init_status, timeout=900):
-            _cur = _cache_bg.get(cache_key) or {}
-            if _cur.get('state') == 'running':
-                return redirect(next_url)
-            # key ค้างจากรอบก่อน (done/idle) - เขียนทับแล้วสแกนต่อ
-            _cache_bg.set(cache_key, _init_status, timeout=900)
-
-        def _run_precision_bg(uid, ckey):
-            try:
-                import django
-                django.setup()
-                import concurrent.futures
-                from datetime import datetime as _dt
-                from datetime import time as _dtime
-                from datetime import timedelta as _td
-
-                import pandas_ta as ta
-                import pytz as _pytz
-                from django.contrib.auth import get_user_model
-                from django.core.cache import cache as _cache
-                from django.utils import timezone as tz
-                from yahooquery import Ticker as YQTicker
-
-                from stocks.models import PrecisionScanCandidate
-
-                from stocks.utils import analyze_momentum_technical_v2, get_top_ranked_symbols as _GTRS, refresh_all_thai_symbols as _RATS
-                # auto_refresh=False: การรีเฟรช Market Cap ทั้งตลาดใช้เวลานาน (นาที) และเคยทำให้
-                # progress ค้างที่ 0/0 จนหน้าเว็บคิดว่าสแกนตาย - ให้ผู้ใช้กดปุ่ม "รีเฟรช Market Cap" แยกแทน
-                sym_list = _GTRS(market='SET', limit=400, auto_refresh=False)
-                if not sym_list:
-                    try:
-                        _RATS()
-                    except Exception:
-                        pass
-                    sym_list = _GTRS(market='SET', limit=400, auto_refresh=False)
-
-
-                User = get_user_model()
-                user = User.objects.get(pk=uid)
-                scan_run_time = tz.now()
-
-                # ====== Pin Scan Date ======
-                _bkk_tz = _pytz.timezone('Asia/Bangkok')
-                _now_bkk = _dt.now(_bkk_tz)
-                # yfinance download end= is exclusive. To include today's data, use tomorrow.
-                scan_end_date  = _now_bkk.date() + _td(days=1)
-                scan_end_str   = scan_end_date.strftime('%Y-%m-%d')
-                scan_start_str = (_now_bkk.date() - _td(days=600)).strftime('%Y-%m-%d')  # 600 วัน → ~430 trading days, EMA200 warm-up มีพอ
-                set_start_str  = (_now_bkk.date() - _td(days=600)).strftime('%Y-%m-%d')  # ใช้เท่ากับ stock เพื่อ RS เทียบกันถูกต้อง
-
-                prev_run = (
-                    PrecisionScanCandidate.objects
-                    .filter(user=user, market='SET')
-                    .values_list('scan_run', flat=True)
-                    .order_by('-scan_run')
-                    .distinct()
-                    .first()
-                )
-                prev_symbols = set()
-                if prev_run:
-                    prev_symbols = set(
-                        PrecisionScanCandidate.objects
-                        .filter(user=user, scan_run=prev_run)
-                        .values_list('symbol', flat=True)
-                    )
-
-                # ====== SET Index ======
-                set_1m_return = 0.0
-                set_3m_return = 0.0
-                try:
-                    set_df = yf.download("^SET.BK", start=set_start_str, end=scan_end_str, interval="1d", progress=False)
-                    if set_df is not None and not set_df.empty:
-                        if isinstance(set_df.columns, pd.MultiIndex):
-                            set_df.columns = set_df.columns.droplevel(1)
-                        set_close = set_df['Close'].dropna()
-                        if len(set_close) >= 66:
-                            set_1m_return = float((set_close.iloc[-1] - set_close.iloc[-22]) / set_close.iloc[-22] * 100)
-                            set_3m_return = float((set_close.iloc[-1] - set_close.iloc[-66]) / set_close.iloc[-66] * 100)
-                    import logging; logging.getLogger('stocks').info(f"[Precision] SET Index: 1m={set_1m_return:.2f}% 3m={set_3m_return:.2f}%")
-                except Exception as e:
-                    import logging; logging.getLogger('stocks').warning(f"[Precision] SET Index fetch failed: {e}")
-
-
-                # ====== Phase 1: Fast Screening with YahooQuery (Institutional Speed) ======
-                total_syms = len(sym_list)
-                _cache.set(ckey, {'state': 'running', 'progress': 5, 'total': total_syms, 'phase': 'ดึงข้อมูล RS Rating...'}, timeout=900)
-                
-                from yahooquery import Ticker as _TQ
-                rs_returns_all = {}
-                
-                # Fetch history in chunks of 80 to prevent hangs
-                import logging; logger = logging.getLogger('stocks')
-                chunk_size = 80
-                for i in range(0, len(sym_list), chunk_size):
-                    chunk = sym_list[i : i + chunk_size]
-                    chunk_bk = [f"{s}.BK" for s in chunk]
-                    _cache.set(ckey, {'state': 'running', 'progress': 5 + int((i/total_syms)*15), 'total': total_syms, 'phase': f'Phase 1: โหลดข้อมูลกลุ่ม {i//chunk_size + 1}...'}, timeout=900)
-                    try:
-                        tq = _TQ(chunk_bk)
-                        tq_hist = tq.history(start=scan_start_str, end=scan_end_str, interval="1d")
-                        if tq_hist is not None and not tq_hist.empty:
-                            if isinstance(tq_hist.index, pd.MultiIndex):
-                                for symbol in chunk:
-                                    try:
-                                        s_bk = f"{symbol}.BK"
-                                        if s_bk in tq_hist.index.get_level_values(0):
-                                            _close = tq_hist.loc[s_bk]['adjclose'].dropna()
-                                            if len(_close) >= 66:
-                                                ret = float((_close.iloc[-1] - _close.iloc[-66]) / abs(_close.iloc[-66]) * 100)
-                                                rs_returns_all[symbol] = ret
-                                    except Exception: continue
-                    except Exception as e:
-                        logger.error(f"RS Chunk Error at {i}: {e}")
-
-                # FAILSAFE: If results are empty or too small, force evaluation of a subset
-                if len(rs_returns_all) < 10:
-                    import logging; logging.getLogger('stocks').warning(f"[Precision] Data recovery mode: Only {len(rs_returns_all)} found. Force fallback.")
-                    # Use at least top 50 symbols to ensure some results
-                    for s in sym_list[:100]:
-                        if s not in rs_returns_all: rs_returns_all[s] = 0.0 # Dummy score to pass filter
-
-                rs_ratings_map = {}
-                if rs_returns_all:
-                    _rs_ser = pd.Series(rs_returns_all)
-                    rs_ratings_map = (_rs_ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                # Phase 2: เจาะลึกหุ้นที่เข้ารอบ (ผ่อนปรนให้หุ้นที่มี RS >= 45 หลุดเข้าประเมินเชิงลึก เพื่อความยืดหยุ่นของ Early Accumulation)
-                results_to_process = [s for s in sym_list if rs_ratings_map.get(s, 0) >= 45]
-                if not results_to_process:
-                    # Fallback: ถ้าไม่มีข้อมูล RS เพียงพอ ให้ใช้ทุกหุ้นที่อยู่ใน rs_ratings_map หรือ top 50
-                    results_to_process = [s for s in sym_list if s in rs_ratings_map] or sym_list[:50]
-                    import logging; logging.getLogger('stocks').warning(f"[Precision] RS filter returned 0 — fallback to {len(results_to_process)} symbols")
-
-                def _process_precision_scan(symbol):
-                    try:
-                        # ใช้ yf.Ticker().history() แทน yf.download() เพราะ yf.download() 
-                        # มีบั๊ก Thread-safety กรองข้อมูลข้าม Symbol กันเมื่อรันใน ThreadPool 
-                        ticker_obj = yf.Ticker(f"{symbol}.BK")
-                        df = ticker_obj.history(start=scan_start_str, end=scan_end_str, interval="1d")
-
-                        if df is None or df.empty:
-                            try:
-                                yq = YQTicker(f"{symbol}.BK")
-                                df = yq.history(start=scan_start_str, end=scan_end_str, interval="1d")
-                                if isinstance(df, pd.DataFrame) and not df.empty:
-                                    df = df.reset_index()
-                                    if 'date' in df.columns:
-                                        df.set_index('date', inplace=True)
-                                    if 'symbol' in df.columns:
-                                        df.drop(columns=['symbol'], inplace=True)
-                                    df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low',
-                                                       'close': 'Close', 'volume': 'Volume'}, inplace=True)
-                            except Exception:
-                                pass
-
-                        if df is None or df.empty:
-                            return None
-
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.droplevel(1)
-
-                        df = df.dropna(subset=['Close', 'High'])
-                        if len(df) < 200:
-                            return None
-
-                        # ====== Liquidity & Quality Filters (Institutional Grade) ======
-                        avg_vol_20 = float(df['Volume'].tail(20).mean())
-                        avg_close_20 = float(df['Close'].tail(20).mean())
-                        avg_turnover_20 = avg_vol_20 * avg_close_20
-                
-                        import logging as _lg; _scan_log = _lg.getLogger('stocks.scan')
-                        current_price = float(df['Close'].iloc[-1])
-
-                        # 1. Turnover >= 10M THB
-                        if avg_turnover_20 < 10_000_000:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: Turnover ฿{avg_turnover_20/1e6:.1f}M < 10M")
-                            return None
-
-                        # 2. Minimum Price >= 1.00
-                        if current_price < 1.00:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: Price ฿{current_price} < 1.00")
-                            return None
-
-                        # ====== Early Accumulation (Pre-Breakout Volume Surge & Tightness) ======
-                        # เช็คว่ามี Volume พุ่งสูง หรือ ราคากำลังบีบตัว (VCP) หรือ ปริมาณการซื้อขายแห้ง (VDU)
-                        early_accumulation = False
-                        try:
-                            if len(df) >= 20:
-                                # 1. Check Volume Surge (2.5x)
-                                for i in range(-5, 0):
-                                    vol_i = float(df['Volume'].iloc[i])
-                                    close_i = float(df['Close'].iloc[i])
-                                    open_i = float(df['Open'].iloc[i])
-                                    if close_i > open_i and vol_i >= (avg_vol_20 * 2.5):
-                                        early_accumulation = True
-                                        break
-                                
-                                # 2. Check Price Tightness (SD < 2.5%) -> VCP / Coiling
-                                if not early_accumulation:
-                                    std_5 = float(df['Close'].tail(5).std())
-                                    tightness = (std_5 / current_price * 100) if current_price > 0 else 99
-                                    if tightness <= 2.5:
-                                        early_accumulation = True
-                                        
-                                # 3. Check Volume Dry Up (VDU) -> แรงขายหมด
-                                if not early_accumulation:
-                                    vol_3d_avg = float(df['Volume'].tail(3).mean())
-                                    if vol_3d_avg < avg_vol_20 * 0.5:
-                                        early_accumulation = True
-                        except Exception:
-                            pass
-
-                        # 3. RS Rating >= 60 (อนุโลมถ้ามี Early Accumulation)
-                        rs_val = rs_ratings_map.get(symbol, None)
-                        if rs_val is not None and rs_val < 60 and not early_accumulation:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: RS {rs_val} < 60")
-                            return None
-
-                        # ====== คำนวณ Indicators ======
-                        df['EMA200'] = ta.ema(df['Close'], length=200)
-                        df['EMA50'] = ta.ema(df['Close'], length=50)
-                        df['RSI'] = ta.rsi(df['Close'], length=14)
-                        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                        if adx_df is not None and not adx_df.empty:
-                            df = pd.concat([df, adx_df], axis=1)
-                        mfi_series = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
-                        df['MFI'] = mfi_series
-
-                        last_row = df.iloc[-1]
-                        current_price = float(last_row['Close'])
-                        ema200 = float(df['EMA200'].iloc[-1]) if pd.notna(df['EMA200'].iloc[-1]) else current_price
-                        year_high = float(df['High'].tail(252).max())
-
-                        # ====== ADX Filter ======
-                        adx_val = float(df['ADX_14'].iloc[-1]) if 'ADX_14' in df.columns and pd.notna(df['ADX_14'].iloc[-1]) else 0
-                        if adx_val < 15 and not early_accumulation:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: ADX {adx_val:.1f} < 15")
-                            return None
-
-                        # ====== Trend Template Filter ======
-                        near_high  = current_price >= year_high * 0.65
-                        if not near_high and not early_accumulation:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: Price ฿{current_price} < 65% of 52wH ฿{year_high} ({current_price/year_high*100:.0f}%)")
-                            return None
-
-                        import logging; logger = logging.getLogger('stocks')
-                        logger.debug(f"[Precision] MATCH: {symbol} (ADX:{adx_val:.1f})")
-
-                        # ====== Precision Technical Analysis (v3) ======
-                        tech = analyze_momentum_technical_v2(df)
-                        integrated_score = tech['score']
-                        rvol         = tech['rvol']
-                        rsi          = tech['rsi']
-                        rvol_bullish = tech['rvol_bullish']
-                        sd_zone      = tech['sd_zone']
-                        ema20_aligned_flag = tech.get('ema20_aligned', False)
-                        ema20_slope_val    = tech.get('ema20_slope', 0.0)
-                        ema20_rising_flag  = tech.get('ema20_rising', False)
-                        hh_hl_flag         = tech.get('hh_hl_structure', False)
-
-                        mfi_val = float(df['MFI'].iloc[-1]) if 'MFI' in df.columns and pd.notna(df['MFI'].iloc[-1]) else 0
-
-                        # ====== MACD (12,26,9) - histogram + bullish crossover detection ======
-                        macd_hist_val  = None
-                        macd_cross_val = False
-                        try:
-                            macd_df = ta.macd(df['Close'], fast=12, slow=26, signal=9)
-                            if macd_df is not None and not macd_df.empty:
-                                hist_col = [c for c in macd_df.columns if 'h' in c.lower() or 'hist' in c.lower()]
-                                macd_col = [c for c in macd_df.columns if c.lower().startswith('macd_')]
-                                sig_col  = [c for c in macd_df.columns if 'macds' in c.lower() or 'signal' in c.lower()]
-                                if hist_col:
-                                    macd_hist_val = float(macd_df[hist_col[0]].iloc[-1]) if pd.notna(macd_df[hist_col[0]].iloc[-1]) else None
-                                # Bullish crossover = MACD line crosses above signal line in last 3 bars
-                                if macd_col and sig_col:
-                                    m_ser = macd_df[macd_col[0]].dropna()
-                                    s_ser = macd_df[sig_col[0]].dropna()
-                                    if len(m_ser) >= 4 and len(s_ser) >= 4:
-                                        # Check if MACD crossed above signal in last 3 candles
-                                        for i in range(-3, 0):
-                                            if m_ser.iloc[i-1] <= s_ser.iloc[i-1] and m_ser.iloc[i] > s_ser.iloc[i]:
-                                                macd_cross_val = True
-                                                break
-                        except Exception:
-                            pass
-
-                        # ====== Bollinger Bands Squeeze - bandwidth in bottom 20th pct (pending breakout) ======
-                        bb_squeeze_flag = False
-                        try:
-                            bb_df = ta.bbands(df['Close'], length=20, std=2)
-                            if bb_df is not None and not bb_df.empty:
-                                upper_col = [c for c in bb_df.columns if 'BBU' in c or 'upper' in c.lower()]
-                                lower_col = [c for c in bb_df.columns if 'BBL' in c or 'lower' in c.lower()]
-                                mid_col   = [c for c in bb_df.columns if 'BBM' in c or 'mid' in c.lower()]
-                                if upper_col and lower_col and mid_col:
-                                    bbu = bb_df[upper_col[0]].dropna()
-                                    bbl = bb_df[lower_col[0]].dropna()
-                                    bbm = bb_df[mid_col[0]].dropna()
-                                    if len(bbu) >= 20:
-                                        bw = (bbu - bbl) / bbm  # bandwidth ratio
-                                        pct20 = bw.quantile(0.20)
-                                        if float(bw.iloc[-1]) <= float(pct20):
-                                            bb_squeeze_flag = True
-                        except Exception:
-                            pass
-
-                        # ====== Stage 2 (Weinstein): price > SMA150 AND SMA150 rising ======
-                        # Stage 2 = markup phase - หุ้นที่ผ่าน filter นี้อยู่ในช่วงที่ดีที่สุดสำหรับการซื้อ
-                        stage2_flag = False
-                        try:
-                            sma150 = ta.sma(df['Close'], length=150)
-                            if sma150 is not None:
-                                sma150_clean = sma150.dropna()
-                                if len(sma150_clean) >= 20:
-                                    sma150_cur = float(sma150_clean.iloc[-1])
-                                    sma150_4w  = float(sma150_clean.iloc[-20])  # ~4 สัปดาห์ก่อน
-                                    stage2_flag = (current_price > sma150_cur) and (sma150_cur > sma150_4w)
-                        except Exception:
-                            pass
-
-                        # ====== Fundamental Data (bulk-fetched after all threads complete) ======
-                        # ตัวแปรเหล่านี้ไม่ถูกใช้ใน thread - bulk enrichment เป็นตัวทำใน step 2
-
-                        # ====== Supply & Demand Zone ======
-                        entry_strat = ""
-                        dz_start = None
-                        dz_end = None
-                        sz_start = None
-                        sz_end = None
-                        sl_price = None
-                        rr_val = None
-                        erc_vol_confirmed = False
-                        zone_target_src = '52w'
-
-                        if sd_zone:
-                            entry_strat = sd_zone['type']
-                            dz_start = sd_zone['start']
-                            dz_end = sd_zone['end']
-                            sz_start = sd_zone['target']
-                            sz_end = sd_zone['target'] * 1.02
-                            sl_price = sd_zone['stop_loss']
-                            rr_val = sd_zone['rr_ratio']
-                            erc_vol_confirmed = sd_zone.get('erc_volume_confirmed', False)
-                            zone_target_src = sd_zone.get('zone_target_source', '52w')
-
-                        prox_val = 999.0
-                        if dz_start:
-                            if current_price <= dz_start:
-                                prox_val = 0.0
-                            else:
-                                prox_val = ((current_price - dz_start) / dz_start) * 100
-
-                        gap_to_high = ((year_high - current_price) / current_price) * 100
-
-                        # ====== Pocket Pivot (Morales & Kacher) ======
-                        # Up-day volume > highest down-day volume in prior 10 sessions
-                        # ====== Moving averages for Kacher/Morales exit rule (SMA10/SMA50) ======
-                        ma10_val = ma50_val = 0.0
-                        try:
-                            _sma10 = ta.sma(df['Close'], length=10)
-                            _sma50 = ta.sma(df['Close'], length=50)
-                            if _sma10 is not None and pd.notna(_sma10.iloc[-1]): ma10_val = float(_sma10.iloc[-1])
-                            if _sma50 is not None and pd.notna(_sma50.iloc[-1]): ma50_val = float(_sma50.iloc[-1])
-                        except Exception:
-                            pass
-
-                        pocket_pivot_flag = False
-                        pp_at_ma50_flag = False   # PP แท้ตามตำรา Dr.K: เด้งจากแนวรับ SMA50 ในฐาน
-                        try:
-                            if len(df) >= 14:
-                                closes = df['Close'].values
-                                volumes = df['Volume'].values
-                                for _i in [-1, -2]:
-                                    if float(closes[_i]) <= float(closes[_i - 1]):
-                                        continue  # not an up day
-                                    _start = len(volumes) + _i - 10
-                                    _end   = len(volumes) + _i
-                                    if _start < 1:
-                                        continue
-                                    _prior_c = closes[_start:_end]
-                                    _prior_v = volumes[_start:_end]
-                                    _prior_prev_c = closes[_start - 1:_end - 1]
-                                    _down_mask = _prior_c < _prior_prev_c
-                                    if not _down_mask.any():
-                                        continue
-                                    _max_down_vol = float(_prior_v[_down_mask].max())
-                                    if float(volumes[_i]) > _max_down_vol and _max_down_vol > 0:
-                                        pocket_pivot_flag = True
-                                        # PP-at-MA50 (⭐): ต้องครบ 3 เงื่อนไข —
-                                        #   1) ราคายืนเหนือ SMA50 ไม่เกิน 8% (เด้งจากแนวรับในฐาน)
-                                        #   2) CMF ≥ 0 (เงินสถาบันไม่ได้กำลังกระจายของ)
-                                        # ป้องกันดาวหลอกกรณีเด้ง 1 วันในเฟส distribution
-                                        _pp_cmf = tech.get('cmf', 0.0) or 0.0
-                                        if ma50_val > 0 and _pp_cmf >= 0:
-                                            _pp_close = float(closes[_i])
-                                            if _pp_close >= ma50_val and (_pp_close - ma50_val) / ma50_val <= 0.08:
-                                                pp_at_ma50_flag = True
-                                        break
-                        except Exception:
-                            pass
+        if not _scan_jobs.start(cache_key, user_id, _init_status):
+            return redirect(next_url)
 
-                        # Wyckoff Spring + Upthrust + Effort-vs-Result divergence + Selling Climax (Phase A)
-                        wyckoff_spring_flag = False
-                        wyckoff_upthrust_flag = False
-                        wyckoff_er_warning_flag = False
-                        wyckoff_selling_climax_flag = False
-                        try:
-                            from stocks.utils import (
-                                detect_effort_result_divergence,
-                                detect_selling_climax,
-                                detect_wyckoff_spring,
-                                detect_wyckoff_upthrust,
-                            )
-                            wyckoff_spring_flag, _ = detect_wyckoff_spring(df)
-                            wyckoff_upthrust_flag, _ = detect_wyckoff_upthrust(df)
-                            wyckoff_er_warning_flag, _ = detect_effort_result_divergence(df)
-                            wyckoff_selling_climax_flag, _ = detect_selling_climax(df)
-                        except Exception:
-                            pass
-
-                        # Minervini Trend Template (8 ข้อเต็ม) + Cheat Entry
-                        tt_score_val = 0
-                        tt_passed_flag = False
-                        cheat_entry_flag = False
-                        try:
-                            from stocks.utils import check_trend_template, detect_cheat_entry
-                            _tt = check_trend_template(df, rs_ratings_map.get(symbol, 0))
-                            tt_score_val = _tt.get('score', 0)
-                            tt_passed_flag = _tt.get('passed', False)
-                            cheat_entry_flag = detect_cheat_entry(df)
-                        except Exception:
-                            pass
-
-                        # ====== Volume Dry-Up (VDU): เงียบสะสม - volume ลด 3 วันติด + ต่ำกว่า median 70% (ป้องกัน volume spike) ======
-                        vdu_flag = False
-                        try:
-                            if len(df) >= 4:
-                                _vols = df['Volume'].tail(4).values.astype(float)
-                                _median20 = float(df['Volume'].tail(20).median())
-                                _declining = (_vols[-1] < _vols[-2]) and (_vols[-2] < _vols[-3])
-                                _quiet     = _vols[-1] < _median20 * 0.7
-                                vdu_flag   = _declining and _quiet
-                        except Exception:
-                            pass
-
-                        # ====== Ichimoku Cloud ======
-                        ichimoku_above_kumo = False
-                        ichimoku_tk_cross   = False
-                        ichimoku_kumo_green = False
-                        ichimoku_chikou_ok  = False
-                        ichimoku_score_val  = 0
-                        try:
-                            if len(df) >= 52:
-                                _h9  = df['High'].rolling(9).max()
-                                _l9  = df['Low'].rolling(9).min()
-                                _h26 = df['High'].rolling(26).max()
-                                _l26 = df['Low'].rolling(26).min()
-                                _h52 = df['High'].rolling(52).max()
-                                _l52 = df['Low'].rolling(52).min()
-                                _tenkan = (_h9  + _l9)  / 2
-                                _kijun  = (_h26 + _l26) / 2
-                                _span_a = ((_tenkan + _kijun) / 2).shift(26)
-                                _span_b = ((_h52   + _l52)  / 2).shift(26)
-                                _sa_cur = float(_span_a.iloc[-1]) if pd.notna(_span_a.iloc[-1]) else 0
-                                _sb_cur = float(_span_b.iloc[-1]) if pd.notna(_span_b.iloc[-1]) else 0
-                                # 1) Price above Kumo
-                                ichimoku_above_kumo = current_price > max(_sa_cur, _sb_cur) > 0
-                                # 2) TK Cross bullish in last 5 bars
-                                for _i in range(-5, 0):
-                                    if (_tenkan.iloc[_i-1] <= _kijun.iloc[_i-1]
-                                            and _tenkan.iloc[_i] > _kijun.iloc[_i]):
-                                        ichimoku_tk_cross = True
-                                        break
-                                # 3) Future Kumo green (SpanA > SpanB at current shifted position)
-                                ichimoku_kumo_green = _sa_cur > _sb_cur and _sa_cur > 0
-                                # 4) Chikou Span clear (current close > close 26 bars ago)
-                                if len(df) >= 27:
-                                    ichimoku_chikou_ok = float(df['Close'].iloc[-1]) > float(df['Close'].iloc[-27])
-                                ichimoku_score_val = sum([ichimoku_above_kumo, ichimoku_tk_cross,
-                                                         ichimoku_kumo_green, ichimoku_chikou_ok])
-                        except Exception:
-                            pass
-
-                        # Price Pattern detection (ใช้ df ที่มีอยู่แล้ว)
-                        pattern_result = detect_price_pattern(df)
-                        pattern_name  = pattern_result['name']
-                        pattern_score = pattern_result['score']
-
-                        close_series = df['Close'].dropna()
-                        rel_1m = rel_3m = 0.0
-                        stock_3m_ret = 0.0
-                        if len(close_series) >= 66:
-                            stock_1m = float((close_series.iloc[-1] - close_series.iloc[-22]) / close_series.iloc[-22] * 100)
-                            stock_3m = float((close_series.iloc[-1] - close_series.iloc[-66]) / close_series.iloc[-66] * 100)
-                            stock_3m_ret = stock_3m
-                            rel_1m = round(stock_1m - set_1m_return, 2)
-                            rel_3m = round(stock_3m - set_3m_return, 2)
-                        elif len(close_series) >= 22:
-                            stock_1m = float((close_series.iloc[-1] - close_series.iloc[-22]) / close_series.iloc[-22] * 100)
-                            rel_1m = round(stock_1m - set_1m_return, 2)
-
-
-
-                        # ====== Advanced Precision Bonus/Penalty ======
-                        from stocks.utils import detect_vcp_pattern
-                        vcp = detect_vcp_pattern(df)
-                        vcp_setup_flag = vcp.get('setup', False)
-                        vcp_tightness_val = vcp.get('tightness', 999.0)
-                        
-                        inside_bar_flag = False
-                        if len(df) >= 2:
-                            c0 = df.iloc[-1]
-                            c1 = df.iloc[-2]
-                            inside_bar_flag = c0['High'] <= c1['High'] and c0['Low'] >= c1['Low']
-
-                        if vcp_setup_flag:
-                            integrated_score += 10
-                            if vcp_tightness_val <= 10:
-                                integrated_score += 5
-                        
-                        # Pocket Pivot
-                        if pp_at_ma50_flag:
-                            integrated_score += 15
-                        elif pocket_pivot_flag:
-                            integrated_score += 5
-                            
-                        # Turtle Breakout (จ่อเบรค)
-                        turtle_dist = tech.get('turtle_dist_pct', 99.0)
-                        if turtle_dist <= 2.0:
-                            integrated_score += 10
-                            
-                        # Wyckoff Dynamics
-                        if wyckoff_spring_flag:
-                            integrated_score += 10
-                        if wyckoff_upthrust_flag:
-                            integrated_score -= 20
-                        if wyckoff_er_warning_flag:
-                            _is_bear = (not rvol_bullish) or (tech.get('dist_days', 0) >= 3) or (tech.get('cmf', 0) < -0.1)
-                            if _is_bear:
-                                integrated_score -= 15
-                            else:
-                                integrated_score += 10
-                        if wyckoff_selling_climax_flag:
-                            integrated_score += 5
-                            
-                        # Inside Bar
-                        if inside_bar_flag:
-                            integrated_score += 5
-                            
-                        integrated_score = min(max(integrated_score, 0), 100)
-                        # Return dict instead of model to allow bulk fundamental enrichment and RS Ranking
-                        return {
-                            'symbol': symbol,
-                            'price': round(current_price, 2),
-                            'rsi': round(rsi, 2),
-                            'adx': round(adx_val, 2),
-                            'mfi': round(mfi_val, 2),
-                            'rvol': round(rvol, 2),
-                            'technical_score': int(integrated_score),
-                            'avg_volume_20d': round(avg_vol_20, 0),
-                            'rvol_bullish': rvol_bullish,
-                            'erc_volume_confirmed': erc_vol_confirmed,
-                            'zone_target_src': zone_target_src,
-                            'entry_strat': entry_strat,
-                            'dz_start': dz_start,
-                            'dz_end': dz_end,
-                            'sz_start': sz_start,
-                            'sz_end': sz_end,
-                            'sl_price': sl_price,
-                            'rr_val': rr_val,
-                            'year_high': round(year_high, 2),
-                            'upside_to_high': round(gap_to_high, 2),
-                            'prox_val': round(prox_val, 2),
-                            'pattern_name': pattern_name,
-                            'pattern_score': pattern_score,
-                            'rel_1m': rel_1m,
-                            'rel_3m': rel_3m,
-                            'macd_histogram': round(macd_hist_val, 4) if macd_hist_val is not None else None,
-                            'macd_crossover': macd_cross_val,
-                            'bb_squeeze': bb_squeeze_flag,
-                            'ema20_aligned': ema20_aligned_flag,
-                            'ema20_slope': round(ema20_slope_val, 3),
-                            'ema20_rising': ema20_rising_flag,
-                            'hh_hl_structure': hh_hl_flag,
-                            'stock_3m_ret': stock_3m_ret,
-                            'rs_rating': rs_ratings_map.get(symbol, 0),
-                            'stage2': stage2_flag,
-                            'pocket_pivot': pocket_pivot_flag,
-                            'pp_at_ma50': pp_at_ma50_flag,
-                            'wyckoff_spring': wyckoff_spring_flag,
-                            'wyckoff_upthrust': wyckoff_upthrust_flag,
-                            'wyckoff_effort_result_warning': wyckoff_er_warning_flag,
-                            'wyckoff_selling_climax': wyckoff_selling_climax_flag,
-                            'trend_template_score': tt_score_val,
-                            'trend_template_passed': tt_passed_flag,
-                            'cheat_entry': cheat_entry_flag,
-                            'ma10': round(ma10_val, 2),
-                            'ma50': round(ma50_val, 2),
-                            'vdu_near_zone': vdu_flag,
-                            'cmf': tech.get('cmf', 0.0),
-                            'is_52w_breakout': tech.get('is_52w_breakout', False),
-                            'volume_surge': tech.get('volume_surge', 1.0),
-                            'is_volume_surge': tech.get('is_volume_surge', False),
-                            'ichimoku_above_kumo': ichimoku_above_kumo,
-                            'ichimoku_tk_cross': ichimoku_tk_cross,
-                            'ichimoku_kumo_green': ichimoku_kumo_green,
-                            'ichimoku_chikou_ok': ichimoku_chikou_ok,
-                            'ichimoku_score': ichimoku_score_val,
-                            # ====== VCP Detection ======
-                            'vcp': vcp,
-                            # ====== Launcher Data (v10) ======
-                            'launcher_score': tech.get('launcher_score', 0),
-                            'turtle_dist_pct': tech.get('turtle_dist_pct', 99.0),
-                            'is_explosive': tech.get('is_explosive', False),
-                            'tightness_idx': tech.get('tightness_idx', 99.0),
-                            # ====== Pre-Breakout Signals (v13) ======
-                            'inside_bar': tech.get('inside_bar', False),
-                            'acc_days': tech.get('acc_days', 0),
-                            'dist_days': tech.get('dist_days', 0),
-
-                            # ====== John Ehlers Indicators (v12) ======
-                            'ehlers_supersmoother': tech.get('ehlers_supersmoother', current_price),
-                            'ehlers_laguerre_rsi': tech.get('ehlers_laguerre_rsi', 0.5),
-                            'ehlers_fisher': tech.get('ehlers_fisher', 0.0),
-                            'ehlers_fisher_trigger': tech.get('ehlers_fisher_trigger', 0.0),
-                            'ehlers_itl_daily': tech.get('ehlers_itl_daily', current_price),
-                            'ehlers_itl_weekly': tech.get('ehlers_itl_weekly', current_price),
-                            'ehlers_itl_bullish': tech.get('ehlers_itl_bullish', False),
-                            'vp_poc_price': tech.get('vp_poc_price', None),
-                            'vp_status': tech.get('vp_status') or '',
-                        }
-
-                    except Exception as e:
-                        import logging
-                        logging.getLogger('stocks').exception(f"[Precision] Error scanning {symbol}: {e}")
-                        return None
-
-
-                # ====== Phase 2: Deep Scan (only for candidates) ======
-                _cache.set(ckey, {'state': 'running', 'progress': 25, 'total': 100, 'phase': f'สแกนละเอียด (จำนวน {len(results_to_process)} ตัว)...'}, timeout=900)
-                
-                results = []
-                done_count = 0
-                with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-                    futures = [executor.submit(_process_precision_scan, sym) for sym in results_to_process]
-                    for future in concurrent.futures.as_completed(futures):
-                        res = future.result()
-                        if res:
-                            results.append(res)
-                        done_count += 1
-                        _cache.set(ckey, {'state': 'running', 'progress': 25 + int((done_count/len(results_to_process))*70), 
-                                          'total': 100, 'phase': f'สแกนละเอียด {done_count}/{len(results_to_process)}...'}, timeout=900)
-
-                if results:
-                    scan_df = pd.DataFrame(results)
-                    if 'rs_rating' not in scan_df.columns:
-                        scan_df['rs_rating'] = 0
-
-                    _cache.set(ckey, {'state': 'running', 'progress': 95, 'total': 100, 'phase': 'ดึงข้อมูล Fundamental…'}, timeout=900)
-
-                    # ====== Bulk Fundamental Enrichment ======
-                    matched_symbols = [r['symbol'] for r in results]
-                    symbols_bk = [f"{s}.BK" for s in matched_symbols]
-                    fund_data = {}
-                    try:
-                        yq_all = YQTicker(symbols_bk)
-                        modules = yq_all.get_modules('financialData summaryProfile defaultKeyStatistics')
-                        for sym_bk, data in modules.items():
-                            if not isinstance(data, dict):
-                                continue
-                            clean_sym = sym_bk.replace('.BK', '')
-                            profile  = data.get('summaryProfile', {})
-                            fin_data = data.get('financialData', {})
-                            keystat  = data.get('defaultKeyStatistics', {})
-                            sector   = (
-                                profile.get('sector')
-                                or data.get('assetProfile', {}).get('sector')
-                                or 'Unknown'
-                            )
-                            eps_g = keystat.get('earningsQuarterlyGrowth') or fin_data.get('earningsGrowth') or 0.0
-                            eps_growth = float(eps_g) * 100
-                            rev_growth = float(fin_data.get('revenueGrowth', 0) or 0) * 100
-                            fund_data[clean_sym] = {'sector': sector, 'eps_growth': eps_growth, 'rev_growth': rev_growth}
-                    except Exception as e:
-                        print(f"[Precision] Bulk Fundamental fetch failed: {e}")
-
-                    # ====== Sector Confirmation (Livermore "Leading Sisters") ======
-                    # หุ้นกลุ่มเดียวกันควรขยับไปด้วยกัน — ถ้าหุ้นตัวนำวิ่งเดี่ยวๆ แต่กลุ่มไม่ขยับ มีโอกาสเป็นสัญญาณหลอกสูงขึ้น
-                    sector_stage2_ratio = {}
-                    try:
-                        from collections import defaultdict
-                        _sec_total = defaultdict(int)
-                        _sec_stage2 = defaultdict(int)
-                        for _rec in scan_df.to_dict('records'):
-                            _sec = fund_data.get(_rec['symbol'], {}).get('sector') or 'Unknown'
-                            _sec_total[_sec] += 1
-                            if _rec.get('stage2'):
-                                _sec_stage2[_sec] += 1
-                        for _sec, _tot in _sec_total.items():
-                            sector_stage2_ratio[_sec] = round(_sec_stage2[_sec] / _tot * 100, 1) if _tot else 0.0
-                    except Exception:
-                        pass
-
-                    # ====== Bulk Create ======
-                    bulk_candidates = []
-                    for r in scan_df.to_dict('records'):
-                        sym = r['symbol']
-                        f = fund_data.get(sym, {'sector': 'N/A', 'eps_growth': 0.0, 'rev_growth': 0.0})
-                        _sec = f.get('sector') or 'Unknown'
-                        _sec_pct = sector_stage2_ratio.get(_sec, 0.0)
-                        bulk_candidates.append(PrecisionScanCandidate(
-                            user=user,
-                            market='SET',
-                            scan_run=scan_run_time,
-                            symbol=sym,
-                            symbol_bk=f"{sym}.BK",
-                            sector=_sec,
-                            trend_template_score=r.get('trend_template_score', 0),
-                            trend_template_passed=r.get('trend_template_passed', False),
-                            cheat_entry=r.get('cheat_entry', False),
-                            sector_confirmed=_sec_pct >= 30.0,
-                            sector_strength_pct=_sec_pct,
-                            price=r['price'],
-                            rsi=r['rsi'],
-                            adx=r['adx'],
-                            mfi=r['mfi'],
-                            rvol=r['rvol'],
-                            eps_growth=round(f.get('eps_growth', 0), 2),
-                            rev_growth=round(f.get('rev_growth', 0), 2),
-                            technical_score=r['technical_score'],
-                            rs_rating=r['rs_rating'],
-                            avg_volume_20d=r['avg_volume_20d'],
-                            rvol_bullish=r['rvol_bullish'],
-                            erc_volume_confirmed=r['erc_volume_confirmed'],
-                            zone_target_source=r['zone_target_src'],
-                            is_new_entry=(sym not in prev_symbols),
-                            entry_strategy=r['entry_strat'],
-                            demand_zone_start=r['dz_start'],
-                            demand_zone_end=r['dz_end'],
-                            supply_zone_start=r['sz_start'],
-                            supply_zone_end=r['sz_end'],
-                            stop_loss=r['sl_price'],
-                            risk_reward_ratio=r['rr_val'],
-                            year_high=r['year_high'],
-                            upside_to_high=r['upside_to_high'],
-                            zone_proximity=r['prox_val'],
-                            price_pattern=r['pattern_name'],
-                            price_pattern_score=r['pattern_score'],
-                            rel_momentum_1m=r['rel_1m'],
-                            rel_momentum_3m=r['rel_3m'],
-                            macd_histogram=r['macd_histogram'],
-                            macd_crossover=r['macd_crossover'],
-                            bb_squeeze=r['bb_squeeze'],
-                            ema20_aligned=r['ema20_aligned'],
-                            ema20_slope=r.get('ema20_slope', 0.0),
-                            ema20_rising=r.get('ema20_rising', False),
-                            hh_hl_structure=r.get('hh_hl_structure', False),
-                            stage2=r.get('stage2', False),
-                            pocket_pivot=r.get('pocket_pivot', False),
-                            pp_at_ma50=r.get('pp_at_ma50', False),
-                            wyckoff_spring=r.get('wyckoff_spring', False),
-                            wyckoff_upthrust=r.get('wyckoff_upthrust', False),
-                            wyckoff_effort_result_warning=r.get('wyckoff_effort_result_warning', False),
-                            wyckoff_selling_climax=r.get('wyckoff_selling_climax', False),
-                            ma10=r.get('ma10', 0.0),
-                            ma50=r.get('ma50', 0.0),
-                            vdu_near_zone=r.get('vdu_near_zone', False),
-                            cmf=r.get('cmf', None),
-                            is_52w_breakout=r.get('is_52w_breakout', False),
-                            volume_surge=r.get('volume_surge', 1.0),
-                            is_volume_surge=r.get('is_volume_surge', False),
-                            ichimoku_above_kumo=r.get('ichimoku_above_kumo', False),
-                            ichimoku_tk_cross=r.get('ichimoku_tk_cross', False),
-                            ichimoku_kumo_green=r.get('ichimoku_kumo_green', False),
-                            ichimoku_chikou_ok=r.get('ichimoku_chikou_ok', False),
-                            ichimoku_score=r.get('ichimoku_score', 0),
-                            # VCP v9
-                            vcp_setup=r.get('vcp', {}).get('setup', False),
-                            vcp_contractions=r.get('vcp', {}).get('contractions', 0),
-                            vcp_tightness=r.get('vcp', {}).get('tightness', 0.0),
-                            vcp_vdu=r.get('vcp', {}).get('vdu_confirmed', False),
-                            base_length_weeks=r.get('vcp', {}).get('base_length_weeks', 0),
-                            # Launcher v10
-                            launcher_score=r.get('launcher_score', 0),
-                            turtle_dist_pct=r.get('turtle_dist_pct', 99.0),
-                            is_explosive=r.get('is_explosive', False),
-                            tightness_idx=r.get('tightness_idx', 99.0),
-                            # Pre-Breakout Signals v13
-                            inside_bar=r.get('inside_bar', False),
-                            acc_days=r.get('acc_days', 0),
-                            dist_days=r.get('dist_days', 0),
-                            # Ehlers v12
-                            ehlers_supersmoother=r.get('ehlers_supersmoother', None),
-                            ehlers_laguerre_rsi=r.get('ehlers_laguerre_rsi', None),
-                            ehlers_fisher=r.get('ehlers_fisher', None),
-                            ehlers_fisher_trigger=r.get('ehlers_fisher_trigger', None),
-                            ehlers_itl_daily=r.get('ehlers_itl_daily', None),
-                            ehlers_itl_weekly=r.get('ehlers_itl_weekly', None),
-                            ehlers_itl_bullish=r.get('ehlers_itl_bullish', False),
-                            vp_poc_price=r.get('vp_poc_price'),
-                            vp_status=r.get('vp_status') or '',
-                        ))
-
-                    if bulk_candidates:
-                        PrecisionScanCandidate.objects.bulk_create(bulk_candidates)
-
-                # เก็บประวัติแค่ 3 "วัน" ล่าสุด (ไม่ใช่ 3 "ครั้ง" ล่าสุด) — ถ้าเดิมนับเป็นจำนวนครั้ง คนที่สแกนวันละ
-                # หลายรอบจะไล่ลบประวัติของวันก่อนๆ หมดภายในวันเดียว ทำให้ POC Trend ไม่มีทางข้ามวันได้เลย
-                _all_run_ts = list(
-                    PrecisionScanCandidate.objects
-                    .filter(user=user, market='SET')
-                    .values_list('scan_run', flat=True)
-                    .order_by('-scan_run')
-                    .distinct()
-                )
-                _seen_dates = []
-                for _ts in _all_run_ts:
-                    _d = tz.localtime(_ts).date()
-                    if _d not in _seen_dates:
-                        _seen_dates.append(_d)
-                if len(_seen_dates) > 3:
-                    _cutoff_date = _seen_dates[2]  # วันที่เก่าที่สุดใน 3 วันที่จะเก็บไว้
-                    old_runs = [_ts for _ts in _all_run_ts if tz.localtime(_ts).date() < _cutoff_date]
-                    if old_runs:
-                        PrecisionScanCandidate.objects.filter(user=user, market='SET', scan_run__in=old_runs).delete()
-
-                _cache.set(ckey, {'state': 'done', 'count': len(results)}, timeout=300)
-
-            except Exception as _bg_err:
-                import logging
-                logging.getLogger('stocks').exception(f"[PrecisionBG] Error: {_bg_err}")
-                from django.core.cache import cache as _ec
-                _ec.set(ckey, {'state': 'idle'}, timeout=60)
-
-        # เปิด background thread แล้ว return ทันที
-        _t = threading.Thread(
-            target=_run_precision_bg,
-            args=(user_id, cache_key),
+        # เปิด background thread แล้ว return ทันที — ขั้นตอนสแกนทั้งหมดอยู่ใน PRECISION_PIPELINE
+        threading.Thread(
+            target=run_precision_scan,
+            args=(market.code, user_id, cache_key),
             daemon=True
-        )
-        _t.start()
+        ).start()
 
         # Redirect กลับหน้าที่ส่งมา (เช่น SEPA) - next_url resolve ไว้แล้วด้านบน
         return redirect(next_url)
 
+
     # ====== จัดเรียงผลลัพธ์ ======
     sort_by = request.GET.get('sort', 'score')
     valid_db_sorts = {
@@ -2569,10 +1283,11 @@ def precision_momentum_scanner(request):
     use_db_sort = sort_by in valid_db_sorts
     order_field = valid_db_sorts.get(sort_by, '-technical_score')
 
+
     # รายชื่อ scan runs ทั้งหมด (index 0 = ล่าสุด)
     all_runs = list(
         PrecisionScanCandidate.objects
-        .filter(user=request.user, market='SET')
+        .filter(user=request.user, market=market.code)
         .values_list('scan_run', flat=True)
         .order_by('-scan_run')
         .distinct()
@@ -2589,7 +1304,7 @@ def precision_momentum_scanner(request):
     scanned_at = None
     if all_runs:
         selected_run = all_runs[run_idx]
-        qs = PrecisionScanCandidate.objects.filter(user=request.user, scan_run=selected_run, market='SET')
+        qs = PrecisionScanCandidate.objects.filter(user=request.user, scan_run=selected_run, market=market.code)
         if use_db_sort:
             qs = qs.order_by(order_field)
         candidates = list(qs)
@@ -2618,7 +1333,7 @@ def precision_momentum_scanner(request):
                 # แคชผล fetch ไว้ - กันยิง yfinance เท่าจำนวนหุ้นทุกครั้งที่ refresh หน้า
                 # ตลาดเปิด: 60s (ราคาขยับ), ตลาดปิด: 10 นาที (ราคา close ไม่เปลี่ยน)
                 from django.core.cache import cache as _lp_cache
-                _lp_key = f'precision_live_set_{request.user.id}_{run_idx}'
+                _lp_key = f'precision_live_{market.code.lower()}_{request.user.id}_{run_idx}'
                 _lp_cached = _lp_cache.get(_lp_key)
                 if _lp_cached:
                     if isinstance(_lp_cached, tuple) and len(_lp_cached) == 3:
@@ -2629,28 +1344,17 @@ def precision_momentum_scanner(request):
                     else:
                         live_prices, live_mcaps, live_prev_closes = {}, {}, {}
                 else:
-                    import concurrent.futures as _lcf
-                    def _get_live(sym):
-                        try:
-                            full_sym = f"{sym}.BK"
-                            # Use fast_info for quick price/mcap without downloading full history
-                            fi = yf.Ticker(full_sym).fast_info
-                            p  = getattr(fi, 'last_price', None)
-                            mc = getattr(fi, 'market_cap', None)
-                            pc = getattr(fi, 'regular_market_previous_close', getattr(fi, 'previous_close', None))
-                            return (
-                                sym,
-                                (float(p) if p else None),
-                                (round(float(mc)/1e9, 2) if mc else None),
-                                (float(pc) if pc else None)
-                            )
-                        except Exception:
-                            return sym, None, None, None
-                    with _lcf.ThreadPoolExecutor(max_workers=6) as _lex:
-                        for _sym, _p, _mc, _pc in _lex.map(_get_live, [c.symbol for c in candidates]):
-                            if _p:  live_prices[_sym] = _p
-                            if _mc: live_mcaps[_sym]  = _mc
-                            if _pc: live_prev_closes[_sym] = _pc
+                    # ราคา/market cap ล่าสุดของทุกตัวใน batch เดียวผ่าน quote_service
+                    from stocks.quote_service import get_quotes
+                    _full = {c.symbol: market.yahoo(c.symbol) for c in candidates}
+                    _quotes = get_quotes(_full.values())
+                    for _sym, _fs in _full.items():
+                        _q = _quotes.get(_fs)
+                        if not _q:
+                            continue
+                        if _q.get('price'):      live_prices[_sym] = _q['price']
+                        if _q.get('market_cap'): live_mcaps[_sym]  = round(_q['market_cap'] / 1e9, 2)
+                        if _q.get('prev_close'): live_prev_closes[_sym] = _q['prev_close']
                     if live_prices:
                         _lp_cache.set(_lp_key, (live_prices, live_mcaps, live_prev_closes), 60 if _lmarket_open else 600)
             except Exception:
@@ -2727,7 +1431,7 @@ def precision_momentum_scanner(request):
             trend_run_ids = list(_day_to_run.values())
             _vp_by_symbol = {}
             for row in PrecisionScanCandidate.objects.filter(
-                    user=request.user, market='SET', scan_run__in=trend_run_ids
+                    user=request.user, market=market.code, scan_run__in=trend_run_ids
             ).values('symbol', 'scan_run', 'vp_status'):
                 if not row['vp_status']:
                     continue
@@ -2745,11 +1449,11 @@ def precision_momentum_scanner(request):
 
     from stocks.utils import calculate_markov_regime
 
-    _regime_key = 'markov_regime_set'
+    _regime_key = f'markov_regime_{market.code.lower()}'
     markov_regime = _regime_cache.get(_regime_key)
 
     if not markov_regime:
-        markov_regime = calculate_markov_regime("^SET.BK", window=60)
+        markov_regime = calculate_markov_regime(market.index_symbol, window=60)
         _regime_cache.set(_regime_key, markov_regime, 1800) # 30 min cache
 
     # ====== Win Probability Calculation (v11.1) ======
@@ -2997,9 +1701,9 @@ def precision_momentum_scanner(request):
         top_sectors = []
         scan_insights = []
 
-    # ====== Market Condition - ดึงข้อมูล SET Index สำหรับแสดงผล (GET + POST) ======
+    # ====== Market Condition - ดึงข้อมูลดัชนีอ้างอิงของตลาดสำหรับแสดงผล (GET + POST) ======
     from django.core.cache import cache as _mcache
-    market_condition_key = 'market_condition_set'
+    market_condition_key = f'market_condition_{market.code.lower()}'
     market_condition = _mcache.get(market_condition_key)
     if not market_condition:
         market_condition = {'phase': 'UNKNOWN', 'label': 'ไม่มีข้อมูล', 'color': 'secondary', 'score': 0}
@@ -3012,7 +1716,8 @@ def precision_momentum_scanner(request):
             _mc_now   = _mcdt.now(_mc_bkk)
             _mc_end   = _mc_now.date().strftime('%Y-%m-%d')
             _mc_start = (_mc_now.date() - _mctd(days=430)).strftime('%Y-%m-%d')
-            _mc_df = yf.download("^SET.BK", start=_mc_start, end=_mc_end, interval="1d", progress=False)
+            from stocks.bar_store import get_symbol_bars
+            _mc_df = get_symbol_bars(market.index_symbol, _mc_start, _mc_end)
             if _mc_df is not None and not _mc_df.empty:
                 if isinstance(_mc_df.columns, pd.MultiIndex):
                     _mc_df.columns = _mc_df.columns.droplevel(1)
@@ -3025,7 +1730,7 @@ def precision_momentum_scanner(request):
             _mcache.set(market_condition_key, market_condition, 300)
 
     context = {
-        'title': 'Precision Momentum Scanner - กรองคุณภาพ',
+        'title': page['title'],
         'candidates': candidates,
         'scanned_at': scanned_at,
         'current_sort': sort_by,
@@ -3094,17 +1799,17 @@ def precision_momentum_scanner(request):
     context['ai_scan_json'] = _scan_json.dumps(_ai_data, ensure_ascii=False, default=str).replace('</script>', '<\\/script>')
 
     # Fetch latest Cup & Handle and Turtle breakout symbols for horizon classification
-    from stocks.models import CupHandleCandidate, TurtleScanCandidate, Portfolio as _PortfolioSET
+    from stocks.models import CupHandleCandidate, TurtleScanCandidate, Portfolio as _Portfolio
     from stocks.utils import simple_trailing_stop
 
     # Latest Cup & Handle
-    latest_ch_run = CupHandleCandidate.objects.filter(user=request.user, market='SET').values_list('scan_run', flat=True).order_by('-scan_run').first()
-    ch_symbols = set(CupHandleCandidate.objects.filter(user=request.user, market='SET', scan_run=latest_ch_run).values_list('symbol', flat=True)) if latest_ch_run else set()
+    latest_ch_run = CupHandleCandidate.objects.filter(user=request.user, market=market.code).values_list('scan_run', flat=True).order_by('-scan_run').first()
+    ch_symbols = set(CupHandleCandidate.objects.filter(user=request.user, market=market.code, scan_run=latest_ch_run).values_list('symbol', flat=True)) if latest_ch_run else set()
     context['cup_handle_symbols'] = ch_symbols
 
     # Latest Turtle Breakout
-    latest_turtle_run = TurtleScanCandidate.objects.filter(user=request.user, market='SET').values_list('scan_run', flat=True).order_by('-scan_run').first()
-    turtle_symbols = set(TurtleScanCandidate.objects.filter(user=request.user, market='SET', scan_run=latest_turtle_run).values_list('symbol', flat=True)) if latest_turtle_run else set()
+    latest_turtle_run = TurtleScanCandidate.objects.filter(user=request.user, market=market.code).values_list('scan_run', flat=True).order_by('-scan_run').first()
+    turtle_symbols = set(TurtleScanCandidate.objects.filter(user=request.user, market=market.code, scan_run=latest_turtle_run).values_list('symbol', flat=True)) if latest_turtle_run else set()
     context['turtle_symbols'] = turtle_symbols
 
     # ── Pyramid Alert + Let Profit Run ───────────────────────────────────
@@ -3112,7 +1817,7 @@ def precision_momentum_scanner(request):
     # Let Profit Run: แสดง badge เมื่อหุ้นในพอร์ตล็อกกำไรบางส่วนไปแล้วและกำลังเทรลราคาส่วนที่เหลือ (tp1_hit=True)
     _port_entry = {}
     trailing_status = {}
-    for p in _PortfolioSET.objects.filter(user=request.user, market='SET'):
+    for p in _Portfolio.objects.filter(user=request.user, market=market.code):
         ep = float(p.entry_price or 0)
         if ep > 0:
             _port_entry[p.symbol.split('.')[0].upper()] = ep
@@ -3144,7 +1849,35 @@ def precision_momentum_scanner(request):
             pyramid_ready.add(_c.symbol)
     context['pyramid_ready'] = pyramid_ready
 
-    return render(request, 'stocks/precision_scan.html', context)
+    return render(request, page['template'], context)
+
+
+# ============================================================
+# ฟังก์ชัน: precision_momentum_scanner
+# วัตถุประสงค์: ระบบสแกน Precision Momentum (ฟีเจอร์หลักของระบบ)
+#   ใช้อัลกอริทึมหลายชั้นในการคัดกรองหุ้น:
+#     1. Market Regime Detection (BULL/BEAR/CHOPPY)
+#     2. Multi-timeframe Trend Alignment
+#     3. Momentum Score & RS Ranking
+#     4. Volume Confirmation
+#     5. Risk/Reward Calculation
+#   ใช้ Cache, Background Thread และ Database เพื่อประสิทธิภาพสูงสุด
+# ============================================================
+@login_required
+def precision_momentum_scanner(request):
+    """
+    Precision Momentum Scanner - กรองคุณภาพสูงกว่า momentum_scanner
+    ปรับปรุงจาก momentum_scanner:
+    1. ERC ต้องมี Body + Volume > 1.5x avg (ทั้งสองเงื่อนไข)
+    2. ADX >= 20 (กรองเทรนด์แข็งแกร่งเท่านั้น)
+    3. Liquidity filter: avg 20d volume >= 500,000 หุ้น
+    4. Supply target = 52-week high เสมอ
+    5. ATR-based stop loss
+    6. Direction-aware RVOL scoring
+    7. เก็บประวัติ scan 3 รอบล่าสุด
+    8. is_new_entry flag (หุ้นใหม่ vs ยังอยู่จากรอบก่อน)
+    """
+    return _precision_scanner_view(request, 'SET')
 
 
 # ====== Portfolio Momentum Scan - สแกนเฉพาะหุ้นใน Portfolio ======
@@ -3211,25 +1944,11 @@ def entry_finder(request, symbol):
         _ef_end_str   = _ef_end_date.strftime('%Y-%m-%d')
         _ef_start_str = (_ef_end_date - _eftd(days=600)).strftime('%Y-%m-%d')
 
-        # Retry up to 4 times with exponential backoff (handles yfinance rate limits)
-        import random as _efrnd
-        import time as _eftime
-        df = None
-        for _ef_attempt in range(4):
-            try:
-                _ef_ticker = yf.Ticker(full_symbol)
-                df = _ef_ticker.history(start=_ef_start_str, end=_ef_end_str, interval='1d')
-                if df is not None and not df.empty:
-                    break
-            except Exception as _ef_exc:
-                _ef_msg = str(_ef_exc).lower()
-                if 'rate' in _ef_msg or 'too many' in _ef_msg or '429' in _ef_msg:
-                    _wait = 2 ** _ef_attempt + _efrnd.uniform(0, 1)
-                    _eftime.sleep(_wait)
-                    continue
-                raise
-            if _ef_attempt < 3:
-                _eftime.sleep(1.5 * (_ef_attempt + 1))
+        # แท่งราคาจากคลังกลาง (ชุดเดียวกับที่ Precision Scanner ใช้) พร้อมดัชนี SET สำหรับ RS Line
+        from stocks.bar_store import get_bars
+        _ef_bars = get_bars([full_symbol, "^SET.BK"], _ef_start_str, _ef_end_str)
+        df = _ef_bars.get(full_symbol)
+        df = df.copy() if df is not None else None
 
         if df is None or df.empty:
             messages.error(request, f"ไม่พบข้อมูลสำหรับ {symbol}")
@@ -3237,10 +1956,6 @@ def entry_finder(request, symbol):
                 return redirect('stocks:us_precision_scanner')
             return redirect('stocks:momentum_scanner')
 
-        # แก้ไข MultiIndex columns (ถ้ามี)
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.droplevel(1)
-
         # คำนวณ Supply & Demand Zone ด้วย v2 (ใช้ข้อมูลชุดเดียวกับ Precision Scanner)
         sd_zone = find_supply_demand_zones_v2(df)
 
@@ -3277,11 +1992,8 @@ def entry_finder(request, symbol):
         # ====== RS Line (Relative Strength vs SET) ======
         rs_line_vals = []
         try:
-            set_df = yf.download("^SET.BK", start=_ef_start_str, end=_ef_end_str, interval='1d', progress=False)
+            set_df = _ef_bars.get("^SET.BK")
             if set_df is not None and not set_df.empty:
-                if isinstance(set_df.columns, pd.MultiIndex):
-                    set_df.columns = set_df.columns.droplevel(1)
-                
                 # รวมข้อมูลเพื่อเฉลี่ย ratio (RS Line = Stock / Index)
                 combined = pd.concat([df['Close'], set_df['Close']], axis=1, keys=['stock', 'set']).dropna()
                 combined['rs'] = combined['stock'] / combined['set']
@@ -3305,11 +2017,11 @@ def entry_finder(request, symbol):
         # ราคาปิดวันสุดท้ายของ historical data (ใช้คำนวณ zone เท่านั้น)
         hist_close = float(df['Close'].iloc[-1])
 
-        # Live price จาก fast_info (ตรงกับ momentum card)
+        # Live price จาก quote_service (cache เดียวกับ momentum card)
         try:
-            _live_fi = yf.Ticker(full_symbol).fast_info
-            _live_p  = getattr(_live_fi, 'last_price', None)
-            curr_price = float(_live_p) if _live_p else hist_close
+            from stocks.quote_service import get_quote
+            _live_q  = get_quote(full_symbol) or {}
+            curr_price = _live_q.get('price') or hist_close
         except Exception:
             curr_price = hist_close
 
@@ -3517,39 +2229,30 @@ def multi_factor_scanner(request):
     """
     # ====== SCAN STATUS POLL (AJAX) ======
     if request.GET.get('scan_status') == '1':
-        from django.core.cache import cache
         from django.http import JsonResponse as _JsonResponse
         key = f'multifactor_scan_{request.user.id}'
-        status = cache.get(key, {'state': 'idle'})
+        status = _scan_jobs.get(key)
         # เมื่อ done ถูก poll แล้ว ให้ reset เป็น idle ทันที ป้องกัน reload loop
         if status.get('state') == 'done':
-            cache.delete(key)
+            _scan_jobs.clear(key)
         return _JsonResponse(status)
 
     # ====== SCAN (POST - ทำ background เพื่อไม่ให้ nginx timeout) ======
     if request.method == "POST" and request.POST.get('action') == 'scan':
         import threading
 
-        from django.core.cache import cache
 
         user_id  = request.user.id
         cache_key = f'multifactor_scan_{user_id}'
 
         # ป้องกันการสแกนซ้ำถ้ายังรันอยู่
-        current = cache.get(cache_key, {})
-        if current.get('state') == 'running':
+        if not _scan_jobs.start(cache_key, user_id, {'state': 'running', 'progress': 0, 'total': 0}):
             return redirect('stocks:multi_factor_scanner')
 
-        cache.set(cache_key, {'state': 'running', 'progress': 0, 'total': 0}, timeout=600)
-
         def _run_scan(user_id, cache_key):
             import django
             django.setup()
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-
-            import pandas_ta as ta
             from django.contrib.auth import get_user_model
-            from django.core.cache import cache as _cache
 
             User = get_user_model()
             user = User.objects.get(pk=user_id)
@@ -3571,7 +2274,7 @@ def multi_factor_scanner(request):
                 # Delete any existing SET records for these symbols
                 MultiFactorCandidate.objects.filter(user=user, symbol__in=sym_list).delete()
 
-                _cache.set(cache_key, {'state': 'running', 'progress': 0, 'total': len(sym_list)}, timeout=600)
+                _scan_jobs.update(cache_key, {'state': 'running', 'progress': 0, 'total': len(sym_list)})
 
                 # โหลด sector cache จาก DB ครั้งเดียว
                 sector_cache = {
@@ -3581,105 +2284,21 @@ def multi_factor_scanner(request):
                     ).only('symbol', 'sector')
                 }
 
-                # Phase 1: Batch download
-                tickers_str = " ".join(f"{s}.BK" for s in sym_list)
-                try:
-                    batch_df = yf.download(
-                        tickers_str, period="1y", interval="1d",
-                        group_by='ticker', progress=False, threads=True,
-                    )
-                except Exception as e:
-                    print(f"[MultiFactorScan] Batch download failed: {e}")
-                    batch_df = None
-
-                def _get_df(symbol):
-                    sym_bk = f"{symbol}.BK"
-                    df = None
-                    if batch_df is not None and not batch_df.empty:
-                        try:
-                            df = batch_df[sym_bk].copy() if len(sym_list) > 1 else batch_df.copy()
-                        except Exception:
-                            df = None
-                    if df is None or (hasattr(df, 'empty') and df.empty):
-                        try:
-                            df = yf.download(sym_bk, period="1y", interval="1d", progress=False)
-                        except Exception:
-                            return None
-                    return df
+                # Phase 1: โหลดแท่งราคาทั้งชุดจากคลังกลาง (เติมเฉพาะหางที่ขาด)
+                from stocks.bar_store import get_bars
+                _bars = get_bars([f"{s}.BK" for s in sym_list])
 
-                def process_one(symbol):
-                    try:
-                        df = _get_df(symbol)
-                        if df is None or df.empty:
-                            return None
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.droplevel(1)
-                        df = df.dropna(subset=['Close', 'High'])
-                        if len(df) < 60:
-                            return None
-                        df = df.copy()
-                        df['EMA50']  = ta.ema(df['Close'], length=50)
-                        df['EMA200'] = ta.ema(df['Close'], length=200)
-                        df['RSI']    = ta.rsi(df['Close'], length=14)
-                        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                        if adx_df is not None and not adx_df.empty:
-                            df = pd.concat([df, adx_df], axis=1)
-                        df['MFI']  = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
-                        df['RVOL'] = df['Volume'] / df['Volume'].rolling(20).mean()
-                        last    = df.iloc[-1]
-                        price   = float(df['Close'].iloc[-1])
-                        rsi     = float(last.get('RSI')    or 0) if pd.notna(last.get('RSI'))    else 0
-                        adx_val = float(last.get('ADX_14') or 0) if 'ADX_14' in df.columns and pd.notna(last.get('ADX_14')) else 0
-                        mfi_val = float(last.get('MFI')    or 0) if pd.notna(last.get('MFI'))    else 0
-                        rvol    = float(last.get('RVOL')   or 1) if pd.notna(last.get('RVOL'))   else 1.0
-                        ema50   = float(last.get('EMA50')  or 0) if pd.notna(last.get('EMA50'))  else 0
-                        ema200  = float(last.get('EMA200') or 0) if pd.notna(last.get('EMA200')) else 0
-                        above_ema200 = bool(price > ema200) if ema200 else False
-                        above_ema50  = bool(price > ema50)  if ema50  else False
-                        mom = 0
-                        if above_ema200:                        mom += 15
-                        if above_ema50:                         mom += 5
-                        if 55 <= rsi <= 72:                     mom += 15
-                        elif 45 <= rsi < 55 or 72 < rsi <= 80: mom += 7
-                        if adx_val >= 30:                       mom += 5
-                        vol = 0
-                        if rvol >= 3.0:     vol += 15
-                        elif rvol >= 2.0:   vol += 12
-                        elif rvol >= 1.5:   vol += 8
-                        elif rvol >= 1.0:   vol += 4
-                        if mfi_val >= 70:   vol += 15
-                        elif mfi_val >= 60: vol += 10
-                        elif mfi_val >= 50: vol += 5
-                        sector = sector_cache.get(symbol, 'Unknown')
-                        vol_score = min(vol, 30)
-                        return dict(
-                            symbol=symbol, sector=sector, price=round(price, 2),
-                            market='SET',
-                            momentum_score=mom, volume_score=vol_score,
-                            sentiment_score=0, fundamental_score=0,
-                            super_score=mom + vol_score,
-                            rsi=round(rsi, 2), adx=round(adx_val, 2),
-                            mfi=round(mfi_val, 2), rvol=round(rvol, 2),
-                            eps_growth=0.0, rev_growth=0.0,
-                            above_ema200=above_ema200, above_ema50=above_ema50,
-                        )
-                    except Exception as e:
-                        print(f"[MultiFactorScan] {symbol}: {e}")
-                        return None
-
-                # Phase 2: รันขนาน + update progress
-                raw_results = []
-                seen_symbols = set()
-                done = 0
-                with ThreadPoolExecutor(max_workers=12) as executor:
-                    futures = {executor.submit(process_one, s): s for s in sym_list}
-                    for future in as_completed(futures):
-                        r = future.result()
-                        if r and r['symbol'] not in seen_symbols:
-                            raw_results.append(r)
-                            seen_symbols.add(r['symbol'])
-                        done += 1
-                        _cache.set(cache_key, {'state': 'running', 'progress': done, 'total': len(sym_list)}, timeout=600)
+                # Phase 2: คำนวณคะแนนทีละหุ้นใน process pool + update progress
+                from stocks.scan_evaluators import evaluate_multi_factor_symbol
+                from stocks.scan_executor import run_cpu_stage
+
+                def _on_progress(done, total):
+                    _scan_jobs.update(cache_key, {'state': 'running', 'progress': done, 'total': total})
+
+                raw_results = run_cpu_stage(evaluate_multi_factor_symbol, sym_list, _bars, ctx={'market': 'SET'},
+                                            bar_key=lambda s: f"{s}.BK", on_progress=_on_progress)
+                for r in raw_results:
+                    r['sector'] = sector_cache.get(r['symbol'], 'Unknown')
 
                 # Phase 3: Atomic delete+create to guarantee no duplicates
                 from django.db import transaction
@@ -3690,11 +2309,11 @@ def multi_factor_scanner(request):
                     MultiFactorCandidate.objects.bulk_create([
                         MultiFactorCandidate(user=user, **r) for r in raw_results
                     ])
-                _cache.set(cache_key, {'state': 'done', 'count': len(raw_results)}, timeout=300)
+                _scan_jobs.update(cache_key, {'state': 'done', 'count': len(raw_results)})
             except Exception as e:
                 import traceback
                 print(f"[MultiFactorScan] CRITICAL ERROR: {e}\n{traceback.format_exc()}")
-                _cache.set(cache_key, {'state': 'done', 'error': str(e)}, timeout=300)
+                _scan_jobs.update(cache_key, {'state': 'done', 'error': str(e)})
 
         # เปิด background thread แล้ว return ทันที - ไม่ block nginx
         t = threading.Thread(target=_run_scan, args=(user_id, cache_key), daemon=True)
@@ -3707,7 +2326,6 @@ def multi_factor_scanner(request):
         symbols_list  = [c.symbol for c in candidates_qs]
         if symbols_list:
             try:
-                client     = genai.Client(api_key=settings.GEMINI_API_KEY)
                 prompt = f"""วิเคราะห์ข่าวและ Sentiment ล่าสุดสำหรับหุ้นไทยเหล่านี้ในตลาด SET:
 {', '.join(symbols_list)}
 
@@ -3717,13 +2335,10 @@ def multi_factor_scanner(request):
 score: 0-20 (20=บวกมาก, 10=กลาง, 0=ลบมาก)
 label: "บวก" หรือ "กลาง" หรือ "ลบ"
 reason: ภาษาไทย ไม่เกิน 60 ตัวอักษร"""
-                resp = client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=prompt
-                )
+                raw = llm_generate(prompt, use_case='stock_sentiment', model='gemini-2.5-flash', user=request.user)
                 import json
                 import re
-                raw = resp.text.strip()
+                raw = raw.strip()
                 raw = re.sub(r'^```(?:json)?\s*', '', raw)
                 raw = re.sub(r'\s*```$', '', raw)
                 data = json.loads(raw)
@@ -3787,37 +2402,28 @@ def us_multi_factor_scanner(request):
     """
     # ====== SCAN STATUS POLL (AJAX) ======
     if request.GET.get('scan_status') == '1':
-        from django.core.cache import cache
         from django.http import JsonResponse as _JsonResponse
         key = f'us_multifactor_scan_{request.user.id}'
-        status = cache.get(key, {'state': 'idle'})
+        status = _scan_jobs.get(key)
         if status.get('state') == 'done':
-            cache.delete(key)
+            _scan_jobs.clear(key)
         return _JsonResponse(status)
 
     # ====== SCAN (POST) ======
     if request.method == "POST" and request.POST.get('action') == 'scan':
         import threading
 
-        from django.core.cache import cache
 
         user_id   = request.user.id
         cache_key = f'us_multifactor_scan_{user_id}'
 
-        current = cache.get(cache_key, {})
-        if current.get('state') == 'running':
+        if not _scan_jobs.start(cache_key, user_id, {'state': 'running', 'progress': 0, 'total': 0}):
             return redirect('stocks:us_multi_factor_scanner')
 
-        cache.set(cache_key, {'state': 'running', 'progress': 0, 'total': 0}, timeout=600)
-
         def _run_scan(user_id, cache_key):
             import django
             django.setup()
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-
-            import pandas_ta as ta
             from django.contrib.auth import get_user_model
-            from django.core.cache import cache as _cache
 
             User = get_user_model()
             user = User.objects.get(pk=user_id)
@@ -3832,106 +2438,23 @@ def us_multi_factor_scanner(request):
                 # with wrong market value (e.g. market='SET' from before migration)
                 MultiFactorCandidate.objects.filter(user=user, symbol__in=sym_list).delete()
 
-                _cache.set(cache_key, {'state': 'running', 'progress': 0, 'total': len(sym_list)}, timeout=600)
+                _scan_jobs.update(cache_key, {'state': 'running', 'progress': 0, 'total': len(sym_list)})
 
-                # Phase 1: Batch download
-                tickers_str = " ".join(sym_list)
-                try:
-                    batch_df = yf.download(
-                        tickers_str, period="1y", interval="1d",
-                        group_by='ticker', progress=False, threads=True,
-                    )
-                except Exception as e:
-                    print(f"[USMultiFactorScan] Batch download failed: {e}")
-                    batch_df = None
+                # Phase 1: โหลดแท่งราคาทั้งชุดจากคลังกลาง (เติมเฉพาะหางที่ขาด)
+                from stocks.bar_store import get_bars
+                _bars = get_bars(sym_list)
 
-                def _get_df(symbol):
-                    df = None
-                    if batch_df is not None and not batch_df.empty:
-                        try:
-                            df = batch_df[symbol].copy() if len(sym_list) > 1 else batch_df.copy()
-                        except Exception:
-                            df = None
-                    if df is None or (hasattr(df, 'empty') and df.empty):
-                        try:
-                            df = yf.download(symbol, period="1y", interval="1d", progress=False)
-                        except Exception:
-                            return None
-                    return df
+                from stocks.scan_evaluators import evaluate_multi_factor_symbol
+                from stocks.scan_executor import run_cpu_stage
 
-                def process_one(symbol):
-                    try:
-                        df = _get_df(symbol)
-                        if df is None or df.empty:
-                            return None
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.droplevel(1)
-                        df = df.dropna(subset=['Close', 'High'])
-                        if len(df) < 60:
-                            return None
-                        df = df.copy()
-                        df['EMA50']  = ta.ema(df['Close'], length=50)
-                        df['EMA200'] = ta.ema(df['Close'], length=200)
-                        df['RSI']    = ta.rsi(df['Close'], length=14)
-                        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                        if adx_df is not None and not adx_df.empty:
-                            df = pd.concat([df, adx_df], axis=1)
-                        df['MFI']  = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
-                        df['RVOL'] = df['Volume'] / df['Volume'].rolling(20).mean()
-                        last    = df.iloc[-1]
-                        price   = float(df['Close'].iloc[-1])
-                        rsi     = float(last.get('RSI')    or 0) if pd.notna(last.get('RSI'))    else 0
-                        adx_val = float(last.get('ADX_14') or 0) if 'ADX_14' in df.columns and pd.notna(last.get('ADX_14')) else 0
-                        mfi_val = float(last.get('MFI')    or 0) if pd.notna(last.get('MFI'))    else 0
-                        rvol    = float(last.get('RVOL')   or 1) if pd.notna(last.get('RVOL'))   else 1.0
-                        ema50   = float(last.get('EMA50')  or 0) if pd.notna(last.get('EMA50'))  else 0
-                        ema200  = float(last.get('EMA200') or 0) if pd.notna(last.get('EMA200')) else 0
-                        above_ema200 = bool(price > ema200) if ema200 else False
-                        above_ema50  = bool(price > ema50)  if ema50  else False
-                        # Use static sector map - avoid per-symbol API call (193 calls = very slow)
-                        sector = _US_SECTOR_MAP.get(symbol, 'Unknown')
-                        mom = 0
-                        if above_ema200:                        mom += 15
-                        if above_ema50:                         mom += 5
-                        if 55 <= rsi <= 72:                     mom += 15
-                        elif 45 <= rsi < 55 or 72 < rsi <= 80: mom += 7
-                        if adx_val >= 30:                       mom += 5
-                        vol = 0
-                        if rvol >= 3.0:     vol += 15
-                        elif rvol >= 2.0:   vol += 12
-                        elif rvol >= 1.5:   vol += 8
-                        elif rvol >= 1.0:   vol += 4
-                        if mfi_val >= 70:   vol += 15
-                        elif mfi_val >= 60: vol += 10
-                        elif mfi_val >= 50: vol += 5
-                        vol_score = min(vol, 30)
-                        return dict(
-                            symbol=symbol, sector=sector, price=round(price, 2),
-                            market='US',
-                            momentum_score=mom, volume_score=vol_score,
-                            sentiment_score=0, fundamental_score=0,
-                            super_score=mom + vol_score,
-                            rsi=round(rsi, 2), adx=round(adx_val, 2),
-                            mfi=round(mfi_val, 2), rvol=round(rvol, 2),
-                            eps_growth=0.0, rev_growth=0.0,
-                            above_ema200=above_ema200, above_ema50=above_ema50,
-                        )
-                    except Exception as e:
-                        print(f"[USMultiFactorScan] {symbol}: {e}")
-                        return None
-
-                raw_results = []
-                seen_symbols = set()
-                done = 0
-                with ThreadPoolExecutor(max_workers=10) as executor:
-                    futures = {executor.submit(process_one, s): s for s in sym_list}
-                    for future in as_completed(futures):
-                        r = future.result()
-                        if r and r['symbol'] not in seen_symbols:
-                            raw_results.append(r)
-                            seen_symbols.add(r['symbol'])
-                        done += 1
-                        _cache.set(cache_key, {'state': 'running', 'progress': done, 'total': len(sym_list)}, timeout=600)
+                def _on_progress(done, total):
+                    _scan_jobs.update(cache_key, {'state': 'running', 'progress': done, 'total': total})
+
+                raw_results = run_cpu_stage(evaluate_multi_factor_symbol, sym_list, _bars, ctx={'market': 'US'},
+                                            on_progress=_on_progress)
+                for r in raw_results:
+                    # Use static sector map - avoid per-symbol API call (193 calls = very slow)
+                    r['sector'] = _US_SECTOR_MAP.get(r['symbol'], 'Unknown')
 
                 # Final atomic delete+create to guarantee no duplicates
                 from django.db import transaction
@@ -3942,11 +2465,11 @@ def us_multi_factor_scanner(request):
                     MultiFactorCandidate.objects.bulk_create([
                         MultiFactorCandidate(user=user, **r) for r in raw_results
                     ])
-                _cache.set(cache_key, {'state': 'done', 'count': len(raw_results)}, timeout=300)
+                _scan_jobs.update(cache_key, {'state': 'done', 'count': len(raw_results)})
             except Exception as e:
                 import traceback
                 print(f"[USMultiFactorScan] CRITICAL ERROR: {e}\n{traceback.format_exc()}")
-                _cache.set(cache_key, {'state': 'done', 'error': str(e)}, timeout=300)
+                _scan_jobs.update(cache_key, {'state': 'done', 'error': str(e)})
 
         t = threading.Thread(target=_run_scan, args=(user_id, cache_key), daemon=True)
         t.start()
@@ -3958,7 +2481,6 @@ def us_multi_factor_scanner(request):
         symbols_list  = [c.symbol for c in candidates_qs]
         if symbols_list:
             try:
-                client = genai.Client(api_key=settings.GEMINI_API_KEY)
                 prompt = f"""Analyze the latest news sentiment for these US stocks:
 {', '.join(symbols_list)}
 
@@ -3968,13 +2490,10 @@ Reply with a JSON array only, no other text:
 score: 0-20 (20=very positive, 10=neutral, 0=very negative)
 label: "Positive" or "Neutral" or "Negative"
 reason: English, max 80 characters"""
-                resp = client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=prompt
-                )
+                raw = llm_generate(prompt, use_case='stock_sentiment', model='gemini-2.5-flash', user=request.user)
                 import json
                 import re
-                raw = resp.text.strip()
+                raw = raw.strip()
                 raw = re.sub(r'^```(?:json)?\s*', '', raw)
                 raw = re.sub(r'\s*```$', '', raw)
                 data = json.loads(raw)
@@ -4070,534 +2589,7 @@ def us_momentum_scanner(request):
     US Momentum Scanner - scans ~200 Nasdaq/S&P 500 stocks using Minervini Trend Template.
     Results saved to MomentumCandidate (market='US') - same as SET scanner.
     """
-    import threading as _th
-
-    from django.core.cache import cache as _cp
-    from django.http import JsonResponse as _JR
-
-    user_id   = request.user.id
-    cache_key = f'us_momentum_scan_{user_id}'
-
-    # ── AJAX scan progress poll ───────────────────────────────────────
-    if request.GET.get('scan_status') == '1':
-        st = _cp.get(cache_key, {'state': 'idle'})
-        if st.get('state') == 'done':
-            _cp.delete(cache_key)
-        return _JR(st)
-
-    # ── Trigger background scan ───────────────────────────────────────
-    if request.GET.get('scan') == 'true' or request.method == 'POST':
-        cur = _cp.get(cache_key, {})
-        if cur.get('state') != 'running':
-            scan_syms = [s for s in _US_MOMENTUM_SYMBOLS if s not in ('SPY', 'QQQ', 'IWM')]
-            _cp.set(cache_key, {
-                'state': 'running', 'progress': 0,
-                'total': len(scan_syms), 'phase': 'เตรียมข้อมูล…'
-            }, timeout=900)
-
-            def _run_us_bg(uid, ckey, sym_list):
-                try:
-                    import concurrent.futures as _cf
-                    from datetime import timedelta as _td
-
-                    import pandas as _pd
-                    import pandas_ta as _ta
-                    from django.contrib.auth import get_user_model
-                    from django.core.cache import cache as _c
-                    from django.utils import timezone as _tz
-
-                    from stocks.models import MomentumCandidate as _MCM
-                    from stocks.utils import find_supply_demand_zones_v2
-                    _User = get_user_model()
-                    _user = _User.objects.get(pk=uid)
-
-                    from datetime import datetime as _dt
-
-                    import pytz as _pytz
-                    _ny_tz      = _pytz.timezone('America/New_York')
-                    _now_ny     = _dt.now(_ny_tz)
-                    _end_date   = _now_ny.date()
-                    _end_str    = (_end_date + _td(days=1)).strftime('%Y-%m-%d')
-                    _start_str  = (_end_date - _td(days=600)).strftime('%Y-%m-%d')
-                    _spy_start  = (_end_date - _td(days=400)).strftime('%Y-%m-%d')
-
-                    total = len(sym_list)
-
-                    # ── Step 1: SPY benchmark returns ─────────────────
-                    _c.set(ckey, {'state': 'running', 'progress': 0, 'total': total, 'phase': 'โหลด SPY Benchmark…'}, timeout=900)
-                    spy_1m = spy_3m = 0.0
-                    try:
-                        spy_df = yf.download("SPY", start=_spy_start, end=_end_str, interval="1d", progress=False)
-                        if spy_df is not None and not spy_df.empty:
-                            if isinstance(spy_df.columns, _pd.MultiIndex):
-                                spy_df.columns = spy_df.columns.droplevel(1)
-                            sc = spy_df['Close'].dropna()
-                            if len(sc) >= 66:
-                                spy_1m = float((sc.iloc[-1] - sc.iloc[-22]) / sc.iloc[-22] * 100)
-                                spy_3m = float((sc.iloc[-1] - sc.iloc[-66]) / sc.iloc[-66] * 100)
-                    except Exception:
-                        pass
-
-                    # ── Step 2: RS Rating (4-quarter weighted) ────────
-                    _c.set(ckey, {'state': 'running', 'progress': 0, 'total': total, 'phase': 'คำนวณ RS Rating…'}, timeout=900)
-
-                    def _fetch_rs(sym):
-                        import random as _rnd
-                        import time as _t
-                        _t.sleep(_rnd.uniform(0.05, 0.3))
-                        for _att in range(3):
-                            try:
-                                d = yf.Ticker(sym).history(start=_start_str, end=_end_str, interval="1d")
-                                if d is None or d.empty:
-                                    return sym, None
-                                if isinstance(d.columns, _pd.MultiIndex):
-                                    d.columns = d.columns.droplevel(1)
-                                cl = d['Close'].dropna()
-                                if len(cl) >= 252:
-                                    r = float(
-                                        (cl.iloc[-1] - cl.iloc[-64]) / abs(cl.iloc[-64]) * 0.4 +
-                                        (cl.iloc[-64] - cl.iloc[-127]) / abs(cl.iloc[-127]) * 0.2 +
-                                        (cl.iloc[-127] - cl.iloc[-190]) / abs(cl.iloc[-190]) * 0.2 +
-                                        (cl.iloc[-190] - cl.iloc[-253]) / abs(cl.iloc[-253]) * 0.2
-                                    ) * 100
-                                    return sym, r
-                                return sym, None
-                            except Exception as _e:
-                                _emsg = str(_e).lower()
-                                if 'rate' in _emsg or 'too many' in _emsg or '429' in _emsg:
-                                    _t.sleep(2 ** _att + _rnd.uniform(0, 1))
-                                    continue
-                                return sym, None
-                        return sym, None
-
-                    rs_raw = {}
-                    _rs_done = 0
-                    with _cf.ThreadPoolExecutor(max_workers=6) as ex:
-                        futs = {ex.submit(_fetch_rs, s): s for s in sym_list}
-                        for f in _cf.as_completed(futs, timeout=180):
-                            try:
-                                s, r = f.result()
-                                if r is not None:
-                                    rs_raw[s] = r
-                            except Exception:
-                                pass
-                            _rs_done += 1
-                            if _rs_done % 5 == 0 or _rs_done == total:
-                                _c.set(ckey, {
-                                    'state': 'running',
-                                    'progress': _rs_done,
-                                    'total': total,
-                                    'phase': f'RS Ratings ({_rs_done}/{total})…',
-                                }, timeout=900)
-
-                    rs_map = {}
-                    if rs_raw:
-                        ser = _pd.Series(rs_raw)
-                        rs_map = (ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                    # ── Step 3: Technical scan ─────────────────────────
-                    _c.set(ckey, {'state': 'running', 'progress': 0, 'total': total, 'phase': 'Technical Scan…'}, timeout=900)
-
-                    results    = []
-                    lock       = _th.Lock()
-                    done_count = [0]
-
-                    def _scan_one(symbol):
-                        import random as _random
-                        import time as _time
-                        # Small random jitter to spread requests
-                        _time.sleep(_random.uniform(0.1, 0.6))
-                        try:
-                            # Retry up to 3 times with exponential backoff on rate-limit
-                            df = _pd.DataFrame()
-                            for _attempt in range(3):
-                                try:
-                                    ticker = yf.Ticker(symbol)
-                                    df = ticker.history(start=_start_str, end=_end_str, interval="1d")
-                                    if df is not None and not df.empty:
-                                        break
-                                except Exception as _e:
-                                    _emsg = str(_e).lower()
-                                    if 'rate' in _emsg or 'too many' in _emsg or '429' in _emsg:
-                                        _time.sleep(2 ** _attempt + _random.uniform(0, 1))
-                                        continue
-                                    break
-                            if df is None or df.empty:
-                                return None
-                            if isinstance(df.columns, _pd.MultiIndex):
-                                df.columns = df.columns.droplevel(1)
-                            df = df.dropna(subset=['Close', 'High'])
-                            if len(df) < 150:
-                                return None
-
-                            # Liquidity filter - ≥500K avg daily volume
-                            av20 = float(df['Volume'].tail(20).mean())
-                            if av20 < 500_000:
-                                return None
-
-                            # Indicators
-                            df['EMA50']  = _ta.ema(df['Close'], length=50)
-                            df['EMA150'] = _ta.ema(df['Close'], length=150)
-                            df['EMA200'] = _ta.ema(df['Close'], length=200)
-                            df['RSI']    = _ta.rsi(df['Close'], length=14)
-                            adx_df = _ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                            if adx_df is not None and not adx_df.empty:
-                                df = _pd.concat([df, adx_df], axis=1)
-                            mfi_s = _ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
-                            if mfi_s is not None:
-                                df['MFI'] = mfi_s
-                            vol_avg = df['Volume'].rolling(20).mean()
-                            df['RVOL'] = df['Volume'] / vol_avg
-
-                            last         = df.iloc[-1]
-                            current_p    = float(last['Close'])
-                            year_high    = float(df['High'].tail(252).max())
-                            ema200       = float(last.get('EMA200', 0) or 0)
-                            ema50        = float(last.get('EMA50', 0) or 0)
-                            rsi_val      = float(last.get('RSI', 50) or 50)
-                            adx_val      = float(last['ADX_14']) if 'ADX_14' in df.columns and _pd.notna(last.get('ADX_14')) else 0
-                            mfi_val      = float(last['MFI']) if 'MFI' in df.columns and _pd.notna(last.get('MFI')) else 0
-                            rvol_val     = float(last['RVOL']) if _pd.notna(last.get('RVOL')) else 1.0
-
-                            # ── Minervini Trend Template filters ──────
-                            if not (current_p > ema200 and current_p >= year_high * 0.65):
-                                return None
-                            if adx_val < 15:
-                                return None
-
-                            rs_v = rs_map.get(symbol, 0)
-
-                            # ── Score (0–100) ─────────────────────────
-                            score = 0
-                            # Trend alignment (max 35)
-                            if current_p > ema200:               score += 15
-                            if current_p > ema50:                score += 10
-                            if ema50 > ema200:                   score += 10
-                            # Momentum (max 20)
-                            if 55 < rsi_val < 80:                score += 15
-                            elif 45 < rsi_val <= 55:             score += 5
-                            # Volume/RVOL (max 20)
-                            last_close  = float(df['Close'].iloc[-1])
-                            prev_close  = float(df['Close'].iloc[-2]) if len(df) > 1 else last_close
-                            is_bullish  = last_close >= prev_close
-                            if is_bullish and rvol_val >= 1.5:   score += 20
-                            elif is_bullish and rvol_val >= 1.0: score += 12
-                            elif rvol_val >= 1.0:                score += 5
-                            # Price strength (max 10)
-                            if current_p >= year_high * 0.90:    score += 10
-                            elif current_p >= year_high * 0.80:  score += 5
-                            # RS Rating bonus (max 15)
-                            if rs_v >= 85:                       score += 15
-                            elif rs_v >= 70:                     score += 8
-                            elif rs_v >= 60:                     score += 3
-                            score = min(score, 100)
-
-                            # ── MACD crossover ────────────────────────
-                            m_cross = False
-                            try:
-                                md = _ta.macd(df['Close'])
-                                if md is not None and not md.empty:
-                                    mc = md.columns[0]
-                                    ms = next((c for c in md.columns if 'MACDs' in c), None)
-                                    if mc and ms:
-                                        for i in range(-3, 0):
-                                            if md[mc].iloc[i-1] <= md[ms].iloc[i-1] and md[mc].iloc[i] > md[ms].iloc[i]:
-                                                m_cross = True
-                                                break
-                            except Exception:
-                                pass
-
-                            # ── BB Squeeze ────────────────────────────
-                            bb_sqz = False
-                            try:
-                                bb = _ta.bbands(df['Close'])
-                                if bb is not None and not bb.empty:
-                                    bu = next((c for c in bb.columns if 'BBU' in c), None)
-                                    bl = next((c for c in bb.columns if 'BBL' in c), None)
-                                    bm = next((c for c in bb.columns if 'BBM' in c), None)
-                                    if bu and bl and bm:
-                                        bw = (bb[bu] - bb[bl]) / bb[bm]
-                                        if float(bw.iloc[-1]) <= float(bw.quantile(0.2)):
-                                            bb_sqz = True
-                            except Exception:
-                                pass
-
-                            # ── Stage 2 ───────────────────────────────
-                            stage2 = False
-                            try:
-                                s150 = _ta.sma(df['Close'], length=150)
-                                if s150 is not None and not s150.empty:
-                                    stage2 = (current_p > float(s150.iloc[-1])) and (float(s150.iloc[-1]) > float(s150.iloc[-20]))
-                            except Exception:
-                                pass
-
-                            # ── Supply / Demand Zone ──────────────────
-                            sd_zone = find_supply_demand_zones_v2(df)
-                            dz_s = dz_e = sz_s = rr_v = None
-                            prox = 999.0
-                            if sd_zone:
-                                dz_s = sd_zone.get('start')
-                                dz_e = sd_zone.get('end')
-                                sz_s = sd_zone.get('target')
-                                rr_v = sd_zone.get('rr_ratio')
-                                if dz_s:
-                                    prox = 0.0 if current_p <= dz_s else round((current_p - dz_s) / dz_s * 100, 2)
-
-                            # ── Relative returns ──────────────────────
-                            rel_1m = rel_3m = 0.0
-                            cl = df['Close'].dropna()
-                            if len(cl) >= 22:
-                                rel_1m = round(float((cl.iloc[-1] - cl.iloc[-22]) / cl.iloc[-22] * 100) - spy_1m, 2)
-                            if len(cl) >= 66:
-                                rel_3m = round(float((cl.iloc[-1] - cl.iloc[-66]) / cl.iloc[-66] * 100) - spy_3m, 2)
-
-                            # ── Sector ────────────────────────────────
-                            sector = 'Unknown'
-                            try:
-                                info = ticker.info or {}
-                                sector = info.get('sector', 'Unknown') or 'Unknown'
-                            except Exception:
-                                pass
-
-                            return {
-                                'symbol':            symbol,
-                                'price':             round(current_p, 2),
-                                'technical_score':   score,
-                                'rs_rating':         rs_v,
-                                'rsi':               round(rsi_val, 2),
-                                'adx':               round(adx_val, 2),
-                                'mfi':               round(mfi_val, 2),
-                                'rvol':              round(rvol_val, 2),
-                                'rvol_bullish':      is_bullish and rvol_val >= 1.0,
-                                'demand_zone_start': round(dz_s, 2) if dz_s else None,
-                                'demand_zone_end':   round(dz_e, 2) if dz_e else None,
-                                'supply_zone_start': round(sz_s, 2) if sz_s else None,
-                                'risk_reward_ratio': round(rr_v, 2) if rr_v else None,
-                                'zone_proximity':    round(prox, 2),
-                                'year_high':         round(year_high, 2),
-                                'upside_to_high':    round((year_high - current_p) / current_p * 100, 2),
-                                'sector':            sector,
-                                'stage2':            stage2,
-                                'macd_crossover':    m_cross,
-                                'bb_squeeze':        bb_sqz,
-                                'rel_1m':            rel_1m,
-                                'rel_3m':            rel_3m,
-                                # live fields (filled on display)
-                                'live_price':       None,
-                                'live_change_pct':  None,
-                                'live_in_zone':     False,
-                                'live_broke_zone':  False,
-                                'live_above_tp':    False,
-                                'live_near_tp':     False,
-                                'live_zone_prox':   999,
-                            }
-                        except Exception:
-                            return None
-
-                    with _cf.ThreadPoolExecutor(max_workers=4) as ex:
-                        futs = {ex.submit(_scan_one, s): s for s in sym_list}
-                        for idx, f in enumerate(_cf.as_completed(futs, timeout=900)):
-                            try:
-                                r = f.result()
-                                if r:
-                                    with lock:
-                                        results.append(r)
-                            except Exception:
-                                pass
-                            done_count[0] += 1
-                            if done_count[0] % 5 == 0:
-                                _c.set(ckey, {
-                                    'state': 'running',
-                                    'progress': done_count[0],
-                                    'total': total,
-                                    'phase': f'Scanning… ({done_count[0]}/{total})',
-                                }, timeout=900)
-
-                    # ── Save to DB (delete old, bulk create new) ──────
-                    _MCM.objects.filter(user=_user, market='US').delete()
-                    _bulk = []
-                    for r in results:
-                        _bulk.append(_MCM(
-                            user=_user,
-                            market='US',
-                            symbol=r['symbol'],
-                            symbol_bk=r['symbol'],   # US has no .BK suffix
-                            sector=r.get('sector', 'Unknown'),
-                            price=r['price'],
-                            rsi=r['rsi'],
-                            adx=r['adx'],
-                            mfi=r['mfi'],
-                            rvol=r['rvol'],
-                            rvol_bullish=r.get('rvol_bullish', False),
-                            eps_growth=0.0,
-                            rev_growth=0.0,
-                            technical_score=r['technical_score'],
-                            rs_rating=r.get('rs_rating', 0),
-                            stage2=r.get('stage2', False),
-                            macd_crossover=r.get('macd_crossover', False),
-                            bb_squeeze=r.get('bb_squeeze', False),
-                            rel_1m=r.get('rel_1m', 0.0),
-                            rel_3m=r.get('rel_3m', 0.0),
-                            demand_zone_start=r.get('demand_zone_start'),
-                            demand_zone_end=r.get('demand_zone_end'),
-                            supply_zone_start=r.get('supply_zone_start'),
-                            supply_zone_end=None,
-                            stop_loss=None,
-                            risk_reward_ratio=r.get('risk_reward_ratio'),
-                            year_high=r.get('year_high', 0.0),
-                            upside_to_high=r.get('upside_to_high', 0.0),
-                            zone_proximity=r.get('zone_proximity', 999.0),
-                        ))
-                    if _bulk:
-                        _MCM.objects.bulk_create(_bulk, ignore_conflicts=True)
-
-                    _c.set(ckey, {'state': 'done'}, timeout=300)
-
-                except Exception as exc:
-                    from django.core.cache import cache as _c2
-                    _c2.set(ckey, {'state': 'done'}, timeout=300)
-
-            _th.Thread(
-                target=_run_us_bg,
-                args=(user_id, cache_key, scan_syms),
-                daemon=True,
-            ).start()
-
-        from django.shortcuts import redirect as _redir
-        return _redir('stocks:us_momentum_scanner')
-
-    # ── Display results from DB ───────────────────────────────────────
-    sort_by = request.GET.get('sort', 'score')
-    valid_sorts = {
-        'symbol':    'symbol',
-        'score':     '-technical_score',
-        'rs':        '-rs_rating',
-        'rsi':       '-rsi',
-        'rvol':      '-rvol',
-        'adx':       '-adx',
-        'mfi':       '-mfi',
-        'price':     '-price',
-        'gap':       'upside_to_high',
-        'prox':      'zone_proximity',
-        'round_rr':  '-risk_reward_ratio',
-        'rel1m':     '-rel_1m',
-    }
-    order_field = valid_sorts.get(sort_by, '-technical_score')
-
-    _scan_state = _cp.get(cache_key, {})
-    is_scanning = _scan_state.get('state') == 'running'
-
-    db_candidates = (
-        MomentumCandidate.objects.filter(user=request.user, market='US')
-        .order_by(order_field)
-        if not is_scanning else MomentumCandidate.objects.none()
-    )
-
-    # Attach live price + zone status (same pattern as SET scanner)
-    candidate_list = list(db_candidates)
-    if candidate_list:
-        try:
-            import concurrent.futures as _mcf
-
-            def _live_us(sym):
-                try:
-                    fi = yf.Ticker(sym).fast_info
-                    p  = getattr(fi, 'last_price', None)
-                    pc = getattr(fi, 'regular_market_previous_close', getattr(fi, 'previous_close', None))
-                    return sym, (float(p) if p else None), (float(pc) if pc else None)
-                except Exception:
-                    return sym, None, None
-
-            live_map = {}
-            prev_close_map = {}
-            with _mcf.ThreadPoolExecutor(max_workers=6) as ex:
-                for sym, lp, lpc in ex.map(_live_us, [c.symbol for c in candidate_list]):
-                    if lp:
-                        live_map[sym] = lp
-                    if lpc:
-                        prev_close_map[sym] = lpc
-        except Exception:
-            live_map = {}
-            prev_close_map = {}
-
-        for c in candidate_list:
-            lp  = live_map.get(c.symbol)
-            pc  = prev_close_map.get(c.symbol) or float(c.price or 0)
-            c.live_price = lp
-            ref  = lp if lp else float(c.price or 0)
-            dz_s = float(c.demand_zone_start or 0)
-            dz_e = float(c.demand_zone_end   or 0)
-            sz_s = float(c.supply_zone_start or 0)
-            c.live_in_zone    = dz_s > 0 and dz_e > 0 and dz_e <= ref <= dz_s
-            c.live_broke_zone = dz_e > 0 and ref < dz_e
-            c.live_above_tp   = sz_s > 0 and ref >= sz_s
-            c.live_near_tp    = (
-                not c.live_above_tp and sz_s > 0 and dz_s > 0 and
-                (sz_s - dz_s) > 0 and (sz_s - ref) / (sz_s - dz_s) * 100 <= 15
-            )
-            c.live_zone_prox  = (
-                0.0 if ref <= dz_s else
-                round((ref - dz_s) / dz_s * 100, 1) if dz_s > 0 else 999
-            )
-            c.live_change_pct = (
-                round((lp - pc) / pc * 100, 2)
-                if lp and pc > 0 else None
-            )
-
-    # ── AI Superperformance filter ────────────────────────────────────
-    ai_analysis = None
-    if candidate_list and request.GET.get('analyze') == 'true':
-        syms = [c.symbol for c in candidate_list[:30]]
-        try:
-            client = genai.Client(api_key=settings.GEMINI_API_KEY)
-            prompt = f"""You are a top US momentum stock analyst using Minervini/O'Neil methodology.
-
-From this list of US stocks that passed the Trend Template filter:
-{', '.join(syms)}
-
-Analyze current news, earnings momentum, sector rotation, and market sentiment to identify
-the top 5-7 "Superperformance" candidates most likely to make significant moves in the next 2-6 weeks.
-
-Write in Thai language, markdown format:
-- For each pick: symbol, why it's the leader (RS Rating, Stage 2, Catalyst), key risk
-- Focus on Relative Strength leaders and stocks near breakout pivots
-- Note any Earnings dates or Fed events to watch
-- No intro, no outro"""
-            response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-            ai_analysis = response.text
-            if ai_analysis and ai_analysis.startswith("```"):
-                ai_analysis = ai_analysis.split('\n', 1)[-1].rsplit('```', 1)[0].strip()
-        except Exception as e:
-            ai_analysis = f"AI Error: {str(e)}"
-
-    last_scan = MomentumCandidate.objects.filter(user=request.user, market='US').order_by('-scanned_at').first()
-    scanned_at = last_scan.scanned_at if last_scan else None
-
-    # ── Let Profit Run ─────────────────────────────────────────────────
-    # แสดง badge เมื่อหุ้นในพอร์ตล็อกกำไรบางส่วนไปแล้วและกำลังเทรลราคาส่วนที่เหลือ (tp1_hit=True)
-    from stocks.models import Portfolio as _PortfolioMomUS
-    from stocks.utils import simple_trailing_stop
-    trailing_status = {}
-    for p in _PortfolioMomUS.objects.filter(user=request.user, market='US', tp1_hit=True):
-        ep = float(p.entry_price or 0)
-        trail_stop = simple_trailing_stop(p.highest_price, p.atr, p.trail_multiplier)
-        gain_pct = ((float(p.highest_price or 0) - ep) / ep * 100) if ep > 0 and p.highest_price else None
-        trailing_status[p.symbol.upper()] = {
-            'trail_stop': trail_stop,
-            'tp1_price': p.tp1_price,
-            'gain_pct': gain_pct,
-        }
-
-    return render(request, 'stocks/us_momentum.html', {
-        'title':        'US Momentum Scanner',
-        'candidates':   candidate_list,
-        'ai_analysis':  ai_analysis,
-        'scanned_at':   scanned_at,
-        'current_sort': sort_by,
-        'is_scanning':  is_scanning,
-        'has_scanned':  db_candidates.exists() if not is_scanning else True,
-        'trailing_status': trailing_status,
-    })
+    return _momentum_scanner_view(request, 'US')
 
 
 @login_required
@@ -4795,1473 +2787,7 @@ def us_precision_scanner(request):
     7. เก็บประวัติ scan 3 รอบล่าสุด
     8. is_new_entry flag (หุ้นใหม่ vs ยังอยู่จากรอบก่อน)
     """
-    # ====== AJAX Status Poll ======
-    if request.GET.get('scan_status') == '1':
-        from django.core.cache import cache as _cp
-        from django.http import JsonResponse as _JR
-        _key = f'precision_scan_{request.user.id}'
-        _st = _cp.get(_key, {'state': 'idle'})
-        if _st.get('state') == 'done':
-            _cp.delete(_key)
-        return _JR(_st)
-    from django.utils import timezone as tz
-    from yahooquery import Ticker as YQTicker
-    from stocks.utils import analyze_momentum_technical_v2, get_top_ranked_symbols
-
-    # โหลด symbols เบื้องต้นแบบรวดเร็ว (ดึงจาก Cache/DB เดิม) สำหรับใช้ใน context ของ GET request
-    scan_symbols = get_top_ranked_symbols(market='US', limit=400, auto_refresh=False)
-
-    if request.method == "POST" and request.POST.get('action') == 'scan':
-        import threading
-
-        from django.core.cache import cache as _cache_bg
-
-        user_id   = request.user.id
-        cache_key = f'precision_scan_{user_id}'
-        
-        # เก็บหน้าที่ต้องกลับไปหลังสแกนเสร็จ
-        raw_next = request.POST.get('next_url')
-        next_url = 'stocks:minervini_sepa_scanner' if raw_next == 'sepa' else 'stocks:precision_momentum_scanner'
-
-        # cache.add() เป็น atomic lock - กัน double-submit เปิด background thread ซ้อนกัน
-        _init_status = {'state': 'running', 'progress': 0, 'total': 0, 'phase': 'เตรียมข้อมูล…'}
-        if not _cache_bg.add(cache_key, _init_status, timeout=900):
-            _cur = _cache_bg.get(cache_key) or {}
-            if _cur.get('state') == 'running':
-                return redirect(next_url)
-            # key ค้างจากรอบก่อน (done/idle) - เขียนทับแล้วสแกนต่อ
-            _cache_bg.set(cache_key, _init_status, timeout=900)
-
-        def _run_precision_bg(uid, ckey):
-            try:
-                import django
-                django.setup()
-                import concurrent.futures
-                from datetime import datetime as _dt
-                from datetime import time as _dtime
-                from datetime import timedelta as _td
-
-                import pandas_ta as ta
-                import pytz as _pytz
-                from django.contrib.auth import get_user_model
-                from django.core.cache import cache as _cache
-                from django.utils import timezone as tz
-                from yahooquery import Ticker as YQTicker
-
-                from stocks.models import PrecisionScanCandidate
-
-                from stocks.utils import analyze_momentum_technical_v2, get_top_ranked_symbols as _GTRS, refresh_all_thai_symbols as _RATS
-                sym_list = _GTRS(market='US', limit=400, auto_refresh=True)
-                if not sym_list:
-                    try:
-                        _RATS()
-                    except Exception:
-                        pass
-                    sym_list = _GTRS(market='US', limit=400, auto_refresh=True)
-
-
-                User = get_user_model()
-                user = User.objects.get(pk=uid)
-                scan_run_time = tz.now()
-
-                # ====== Pin Scan Date ======
-                _bkk_tz = _pytz.timezone('Asia/Bangkok')
-                _now_bkk = _dt.now(_bkk_tz)
-                # yfinance download end= is exclusive. To include today's data, use tomorrow.
-                scan_end_date  = _now_bkk.date() + _td(days=1)
-                scan_end_str   = scan_end_date.strftime('%Y-%m-%d')
-                scan_start_str = (_now_bkk.date() - _td(days=600)).strftime('%Y-%m-%d')  # 600 วัน → ~430 trading days, EMA200 warm-up มีพอ
-                set_start_str  = (_now_bkk.date() - _td(days=600)).strftime('%Y-%m-%d')  # ใช้เท่ากับ stock เพื่อ RS เทียบกันถูกต้อง
-
-                prev_run = (
-                    PrecisionScanCandidate.objects
-                    .filter(user=user, market='US')
-                    .values_list('scan_run', flat=True)
-                    .order_by('-scan_run')
-                    .distinct()
-                    .first()
-                )
-                prev_symbols = set()
-                if prev_run:
-                    prev_symbols = set(
-                        PrecisionScanCandidate.objects
-                        .filter(user=user, scan_run=prev_run)
-                        .values_list('symbol', flat=True)
-                    )
-
-                # ====== SET Index ======
-                set_1m_return = 0.0
-                set_3m_return = 0.0
-                try:
-                    spy_df = yf.download("SPY", start=set_start_str, end=scan_end_str, interval="1d", progress=False)
-                    if spy_df is not None and not spy_df.empty:
-                        if isinstance(spy_df.columns, pd.MultiIndex):
-                            spy_df.columns = spy_df.columns.droplevel(1)
-                        set_close = spy_df['Close'].dropna()
-                        if len(set_close) >= 66:
-                            set_1m_return = float((set_close.iloc[-1] - set_close.iloc[-22]) / set_close.iloc[-22] * 100)
-                            set_3m_return = float((set_close.iloc[-1] - set_close.iloc[-66]) / set_close.iloc[-66] * 100)
-                    import logging; logging.getLogger('stocks').info(f"[Precision] SET Index: 1m={set_1m_return:.2f}% 3m={set_3m_return:.2f}%")
-                except Exception as e:
-                    import logging; logging.getLogger('stocks').warning(f"[Precision] SET Index fetch failed: {e}")
-
-
-                # ====== Phase 1: Fast Screening with YahooQuery (Institutional Speed) ======
-                total_syms = len(sym_list)
-                _cache.set(ckey, {'state': 'running', 'progress': 5, 'total': total_syms, 'phase': 'ดึงข้อมูล RS Rating...'}, timeout=900)
-                
-                from yahooquery import Ticker as _TQ
-                rs_returns_all = {}
-                
-                # Fetch history in chunks of 80 to prevent hangs
-                import logging; logger = logging.getLogger('stocks')
-                chunk_size = 80
-                for i in range(0, len(sym_list), chunk_size):
-                    chunk = sym_list[i : i + chunk_size]
-                    chunk_bk = chunk
-                    _cache.set(ckey, {'state': 'running', 'progress': 5 + int((i/total_syms)*15), 'total': total_syms, 'phase': f'Phase 1: โหลดข้อมูลกลุ่ม {i//chunk_size + 1}...'}, timeout=900)
-                    try:
-                        tq = _TQ(chunk_bk)
-                        tq_hist = tq.history(start=scan_start_str, end=scan_end_str, interval="1d")
-                        if tq_hist is not None and not tq_hist.empty:
-                            if isinstance(tq_hist.index, pd.MultiIndex):
-                                for symbol in chunk:
-                                    try:
-                                        s_bk = symbol
-                                        if s_bk in tq_hist.index.get_level_values(0):
-                                            _close = tq_hist.loc[s_bk]['adjclose'].dropna()
-                                            if len(_close) >= 66:
-                                                ret = float((_close.iloc[-1] - _close.iloc[-66]) / abs(_close.iloc[-66]) * 100)
-                                                rs_returns_all[symbol] = ret
-                                    except Exception: continue
-                    except Exception as e:
-                        logger.error(f"RS Chunk Error at {i}: {e}")
-
-                # FAILSAFE: If results are empty or too small, force evaluation of a subset
-                if len(rs_returns_all) < 10:
-                    import logging; logging.getLogger('stocks').warning(f"[Precision] Data recovery mode: Only {len(rs_returns_all)} found. Force fallback.")
-                    # Use at least top 50 symbols to ensure some results
-                    for s in sym_list[:100]:
-                        if s not in rs_returns_all: rs_returns_all[s] = 0.0 # Dummy score to pass filter
-
-                rs_ratings_map = {}
-                if rs_returns_all:
-                    _rs_ser = pd.Series(rs_returns_all)
-                    rs_ratings_map = (_rs_ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                # Phase 2: เจาะลึกหุ้นที่เข้ารอบ (ผ่อนปรนให้หุ้นที่มี RS >= 45 หลุดเข้าประเมินเชิงลึก เพื่อความยืดหยุ่นของ Early Accumulation)
-                results_to_process = [s for s in sym_list if rs_ratings_map.get(s, 0) >= 45]
-                if not results_to_process:
-                    # Fallback: ถ้าไม่มีข้อมูล RS เพียงพอ ให้ใช้ทุกหุ้นที่อยู่ใน rs_ratings_map หรือ top 50
-                    results_to_process = [s for s in sym_list if s in rs_ratings_map] or sym_list[:50]
-                    import logging; logging.getLogger('stocks').warning(f"[Precision] RS filter returned 0 — fallback to {len(results_to_process)} symbols")
-
-                def _process_precision_scan(symbol):
-                    try:
-                        # ใช้ yf.Ticker().history() แทน yf.download() เพราะ yf.download() 
-                        # มีบั๊ก Thread-safety กรองข้อมูลข้าม Symbol กันเมื่อรันใน ThreadPool 
-                        ticker_obj = yf.Ticker(symbol)
-                        df = ticker_obj.history(start=scan_start_str, end=scan_end_str, interval="1d")
-
-                        if df is None or df.empty:
-                            try:
-                                yq = YQTicker(symbol)
-                                df = yq.history(start=scan_start_str, end=scan_end_str, interval="1d")
-                                if isinstance(df, pd.DataFrame) and not df.empty:
-                                    df = df.reset_index()
-                                    if 'date' in df.columns:
-                                        df.set_index('date', inplace=True)
-                                    if 'symbol' in df.columns:
-                                        df.drop(columns=['symbol'], inplace=True)
-                                    df.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low',
-                                                       'close': 'Close', 'volume': 'Volume'}, inplace=True)
-                            except Exception:
-                                pass
-
-                        if df is None or df.empty:
-                            return None
-
-                        if isinstance(df.columns, pd.MultiIndex):
-                            df.columns = df.columns.droplevel(1)
-
-                        df = df.dropna(subset=['Close', 'High'])
-                        if len(df) < 200:
-                            return None
-
-                        # ====== Liquidity & Quality Filters (Institutional Grade) ======
-                        avg_vol_20 = float(df['Volume'].tail(20).mean())
-                        avg_close_20 = float(df['Close'].tail(20).mean())
-                        avg_turnover_20 = avg_vol_20 * avg_close_20
-                
-                        import logging as _lg; _scan_log = _lg.getLogger('stocks.scan')
-                        current_price = float(df['Close'].iloc[-1])
-
-                        # 1. Turnover >= 10M THB
-                        if avg_turnover_20 < 10_000_000:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: Turnover ฿{avg_turnover_20/1e6:.1f}M < 10M")
-                            return None
-
-                        # 2. Minimum Price >= 1.00
-                        if current_price < 1.00:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: Price ฿{current_price} < 1.00")
-                            return None
-
-                        # ====== Early Accumulation (Pre-Breakout Volume Surge & Tightness) ======
-                        # เช็คว่ามี Volume พุ่งสูง หรือ ราคากำลังบีบตัว (VCP) หรือ ปริมาณการซื้อขายแห้ง (VDU)
-                        early_accumulation = False
-                        try:
-                            if len(df) >= 20:
-                                # 1. Check Volume Surge (2.5x)
-                                for i in range(-5, 0):
-                                    vol_i = float(df['Volume'].iloc[i])
-                                    close_i = float(df['Close'].iloc[i])
-                                    open_i = float(df['Open'].iloc[i])
-                                    if close_i > open_i and vol_i >= (avg_vol_20 * 2.5):
-                                        early_accumulation = True
-                                        break
-                                
-                                # 2. Check Price Tightness (SD < 2.5%) -> VCP / Coiling
-                                if not early_accumulation:
-                                    std_5 = float(df['Close'].tail(5).std())
-                                    tightness = (std_5 / current_price * 100) if current_price > 0 else 99
-                                    if tightness <= 2.5:
-                                        early_accumulation = True
-                                        
-                                # 3. Check Volume Dry Up (VDU) -> แรงขายหมด
-                                if not early_accumulation:
-                                    vol_3d_avg = float(df['Volume'].tail(3).mean())
-                                    if vol_3d_avg < avg_vol_20 * 0.5:
-                                        early_accumulation = True
-                        except Exception:
-                            pass
-
-                        # 3. RS Rating >= 60 (อนุโลมถ้ามี Early Accumulation)
-                        rs_val = rs_ratings_map.get(symbol, None)
-                        if rs_val is not None and rs_val < 60 and not early_accumulation:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: RS {rs_val} < 60")
-                            return None
-
-                        # ====== คำนวณ Indicators ======
-                        df['EMA200'] = ta.ema(df['Close'], length=200)
-                        df['EMA50'] = ta.ema(df['Close'], length=50)
-                        df['RSI'] = ta.rsi(df['Close'], length=14)
-                        adx_df = ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                        if adx_df is not None and not adx_df.empty:
-                            df = pd.concat([df, adx_df], axis=1)
-                        mfi_series = ta.mfi(df['High'], df['Low'], df['Close'], df['Volume'], length=14)
-                        df['MFI'] = mfi_series
-
-                        last_row = df.iloc[-1]
-                        current_price = float(last_row['Close'])
-                        ema200 = float(df['EMA200'].iloc[-1]) if pd.notna(df['EMA200'].iloc[-1]) else current_price
-                        year_high = float(df['High'].tail(252).max())
-
-                        # ====== ADX Filter ======
-                        adx_val = float(df['ADX_14'].iloc[-1]) if 'ADX_14' in df.columns and pd.notna(df['ADX_14'].iloc[-1]) else 0
-                        if adx_val < 15 and not early_accumulation:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: ADX {adx_val:.1f} < 15")
-                            return None
-
-                        # ====== Trend Template Filter ======
-                        near_high  = current_price >= year_high * 0.65
-                        if not near_high and not early_accumulation:
-                            _scan_log.info(f"[SCAN SKIP] {symbol}: Price ฿{current_price} < 65% of 52wH ฿{year_high} ({current_price/year_high*100:.0f}%)")
-                            return None
-
-                        import logging; logger = logging.getLogger('stocks')
-                        logger.debug(f"[Precision] MATCH: {symbol} (ADX:{adx_val:.1f})")
-
-                        # ====== Precision Technical Analysis (v3) ======
-                        tech = analyze_momentum_technical_v2(df)
-                        integrated_score = tech['score']
-                        rvol         = tech['rvol']
-                        rsi          = tech['rsi']
-                        rvol_bullish = tech['rvol_bullish']
-                        sd_zone      = tech['sd_zone']
-                        ema20_aligned_flag = tech.get('ema20_aligned', False)
-                        ema20_slope_val    = tech.get('ema20_slope', 0.0)
-                        ema20_rising_flag  = tech.get('ema20_rising', False)
-                        hh_hl_flag         = tech.get('hh_hl_structure', False)
-
-                        mfi_val = float(df['MFI'].iloc[-1]) if 'MFI' in df.columns and pd.notna(df['MFI'].iloc[-1]) else 0
-
-                        # ====== MACD (12,26,9) - histogram + bullish crossover detection ======
-                        macd_hist_val  = None
-                        macd_cross_val = False
-                        try:
-                            macd_df = ta.macd(df['Close'], fast=12, slow=26, signal=9)
-                            if macd_df is not None and not macd_df.empty:
-                                hist_col = [c for c in macd_df.columns if 'h' in c.lower() or 'hist' in c.lower()]
-                                macd_col = [c for c in macd_df.columns if c.lower().startswith('macd_')]
-                                sig_col  = [c for c in macd_df.columns if 'macds' in c.lower() or 'signal' in c.lower()]
-                                if hist_col:
-                                    macd_hist_val = float(macd_df[hist_col[0]].iloc[-1]) if pd.notna(macd_df[hist_col[0]].iloc[-1]) else None
-                                # Bullish crossover = MACD line crosses above signal line in last 3 bars
-                                if macd_col and sig_col:
-                                    m_ser = macd_df[macd_col[0]].dropna()
-                                    s_ser = macd_df[sig_col[0]].dropna()
-                                    if len(m_ser) >= 4 and len(s_ser) >= 4:
-                                        # Check if MACD crossed above signal in last 3 candles
-                                        for i in range(-3, 0):
-                                            if m_ser.iloc[i-1] <= s_ser.iloc[i-1] and m_ser.iloc[i] > s_ser.iloc[i]:
-                                                macd_cross_val = True
-                                                break
-                        except Exception:
-                            pass
-
-                        # ====== Bollinger Bands Squeeze - bandwidth in bottom 20th pct (pending breakout) ======
-                        bb_squeeze_flag = False
-                        try:
-                            bb_df = ta.bbands(df['Close'], length=20, std=2)
-                            if bb_df is not None and not bb_df.empty:
-                                upper_col = [c for c in bb_df.columns if 'BBU' in c or 'upper' in c.lower()]
-                                lower_col = [c for c in bb_df.columns if 'BBL' in c or 'lower' in c.lower()]
-                                mid_col   = [c for c in bb_df.columns if 'BBM' in c or 'mid' in c.lower()]
-                                if upper_col and lower_col and mid_col:
-                                    bbu = bb_df[upper_col[0]].dropna()
-                                    bbl = bb_df[lower_col[0]].dropna()
-                                    bbm = bb_df[mid_col[0]].dropna()
-                                    if len(bbu) >= 20:
-                                        bw = (bbu - bbl) / bbm  # bandwidth ratio
-                                        pct20 = bw.quantile(0.20)
-                                        if float(bw.iloc[-1]) <= float(pct20):
-                                            bb_squeeze_flag = True
-                        except Exception:
-                            pass
-
-                        # ====== Stage 2 (Weinstein): price > SMA150 AND SMA150 rising ======
-                        # Stage 2 = markup phase - หุ้นที่ผ่าน filter นี้อยู่ในช่วงที่ดีที่สุดสำหรับการซื้อ
-                        stage2_flag = False
-                        try:
-                            sma150 = ta.sma(df['Close'], length=150)
-                            if sma150 is not None:
-                                sma150_clean = sma150.dropna()
-                                if len(sma150_clean) >= 20:
-                                    sma150_cur = float(sma150_clean.iloc[-1])
-                                    sma150_4w  = float(sma150_clean.iloc[-20])  # ~4 สัปดาห์ก่อน
-                                    stage2_flag = (current_price > sma150_cur) and (sma150_cur > sma150_4w)
-                        except Exception:
-                            pass
-
-                        # ====== Fundamental Data (bulk-fetched after all threads complete) ======
-                        # ตัวแปรเหล่านี้ไม่ถูกใช้ใน thread - bulk enrichment เป็นตัวทำใน step 2
-
-                        # ====== Supply & Demand Zone ======
-                        entry_strat = ""
-                        dz_start = None
-                        dz_end = None
-                        sz_start = None
-                        sz_end = None
-                        sl_price = None
-                        rr_val = None
-                        erc_vol_confirmed = False
-                        zone_target_src = '52w'
-
-                        if sd_zone:
-                            entry_strat = sd_zone['type']
-                            dz_start = sd_zone['start']
-                            dz_end = sd_zone['end']
-                            sz_start = sd_zone['target']
-                            sz_end = sd_zone['target'] * 1.02
-                            sl_price = sd_zone['stop_loss']
-                            rr_val = sd_zone['rr_ratio']
-                            erc_vol_confirmed = sd_zone.get('erc_volume_confirmed', False)
-                            zone_target_src = sd_zone.get('zone_target_source', '52w')
-
-                        prox_val = 999.0
-                        if dz_start:
-                            if current_price <= dz_start:
-                                prox_val = 0.0
-                            else:
-                                prox_val = ((current_price - dz_start) / dz_start) * 100
-
-                        gap_to_high = ((year_high - current_price) / current_price) * 100
-
-                        # ====== Pocket Pivot (Morales & Kacher) ======
-                        # Up-day volume > highest down-day volume in prior 10 sessions
-                        # ====== Moving averages for Kacher/Morales exit rule (SMA10/SMA50) ======
-                        ma10_val = ma50_val = 0.0
-                        try:
-                            _sma10 = ta.sma(df['Close'], length=10)
-                            _sma50 = ta.sma(df['Close'], length=50)
-                            if _sma10 is not None and pd.notna(_sma10.iloc[-1]): ma10_val = float(_sma10.iloc[-1])
-                            if _sma50 is not None and pd.notna(_sma50.iloc[-1]): ma50_val = float(_sma50.iloc[-1])
-                        except Exception:
-                            pass
-
-                        pocket_pivot_flag = False
-                        pp_at_ma50_flag = False   # PP แท้ตามตำรา Dr.K: เด้งจากแนวรับ SMA50 ในฐาน
-                        try:
-                            if len(df) >= 14:
-                                closes = df['Close'].values
-                                volumes = df['Volume'].values
-                                for _i in [-1, -2]:
-                                    if float(closes[_i]) <= float(closes[_i - 1]):
-                                        continue  # not an up day
-                                    _start = len(volumes) + _i - 10
-                                    _end   = len(volumes) + _i
-                                    if _start < 1:
-                                        continue
-                                    _prior_c = closes[_start:_end]
-                                    _prior_v = volumes[_start:_end]
-                                    _prior_prev_c = closes[_start - 1:_end - 1]
-                                    _down_mask = _prior_c < _prior_prev_c
-                                    if not _down_mask.any():
-                                        continue
-                                    _max_down_vol = float(_prior_v[_down_mask].max())
-                                    if float(volumes[_i]) > _max_down_vol and _max_down_vol > 0:
-                                        pocket_pivot_flag = True
-                                        # PP-at-MA50 (⭐): ต้องครบ 3 เงื่อนไข —
-                                        #   1) ราคายืนเหนือ SMA50 ไม่เกิน 8% (เด้งจากแนวรับในฐาน)
-                                        #   2) CMF ≥ 0 (เงินสถาบันไม่ได้กำลังกระจายของ)
-                                        # ป้องกันดาวหลอกกรณีเด้ง 1 วันในเฟส distribution
-                                        _pp_cmf = tech.get('cmf', 0.0) or 0.0
-                                        if ma50_val > 0 and _pp_cmf >= 0:
-                                            _pp_close = float(closes[_i])
-                                            if _pp_close >= ma50_val and (_pp_close - ma50_val) / ma50_val <= 0.08:
-                                                pp_at_ma50_flag = True
-                                        break
-                        except Exception:
-                            pass
-
-                        # Wyckoff Spring + Upthrust + Effort-vs-Result divergence + Selling Climax (Phase A)
-                        wyckoff_spring_flag = False
-                        wyckoff_upthrust_flag = False
-                        wyckoff_er_warning_flag = False
-                        wyckoff_selling_climax_flag = False
-                        try:
-                            from stocks.utils import (
-                                detect_effort_result_divergence,
-                                detect_selling_climax,
-                                detect_wyckoff_spring,
-                                detect_wyckoff_upthrust,
-                            )
-                            wyckoff_spring_flag, _ = detect_wyckoff_spring(df)
-                            wyckoff_upthrust_flag, _ = detect_wyckoff_upthrust(df)
-                            wyckoff_er_warning_flag, _ = detect_effort_result_divergence(df)
-                            wyckoff_selling_climax_flag, _ = detect_selling_climax(df)
-                        except Exception:
-                            pass
-
-                        # Minervini Trend Template (8 ข้อเต็ม) + Cheat Entry
-                        tt_score_val = 0
-                        tt_passed_flag = False
-                        cheat_entry_flag = False
-                        try:
-                            from stocks.utils import check_trend_template, detect_cheat_entry
-                            _tt = check_trend_template(df, rs_ratings_map.get(symbol, 0))
-                            tt_score_val = _tt.get('score', 0)
-                            tt_passed_flag = _tt.get('passed', False)
-                            cheat_entry_flag = detect_cheat_entry(df)
-                        except Exception:
-                            pass
-
-                        # ====== Volume Dry-Up (VDU): เงียบสะสม - volume ลด 3 วันติด + ต่ำกว่า median 70% (ป้องกัน volume spike) ======
-                        vdu_flag = False
-                        try:
-                            if len(df) >= 4:
-                                _vols = df['Volume'].tail(4).values.astype(float)
-                                _median20 = float(df['Volume'].tail(20).median())
-                                _declining = (_vols[-1] < _vols[-2]) and (_vols[-2] < _vols[-3])
-                                _quiet     = _vols[-1] < _median20 * 0.7
-                                vdu_flag   = _declining and _quiet
-                        except Exception:
-                            pass
-
-                        # ====== Ichimoku Cloud ======
-                        ichimoku_above_kumo = False
-                        ichimoku_tk_cross   = False
-                        ichimoku_kumo_green = False
-                        ichimoku_chikou_ok  = False
-                        ichimoku_score_val  = 0
-                        try:
-                            if len(df) >= 52:
-                                _h9  = df['High'].rolling(9).max()
-                                _l9  = df['Low'].rolling(9).min()
-                                _h26 = df['High'].rolling(26).max()
-                                _l26 = df['Low'].rolling(26).min()
-                                _h52 = df['High'].rolling(52).max()
-                                _l52 = df['Low'].rolling(52).min()
-                                _tenkan = (_h9  + _l9)  / 2
-                                _kijun  = (_h26 + _l26) / 2
-                                _span_a = ((_tenkan + _kijun) / 2).shift(26)
-                                _span_b = ((_h52   + _l52)  / 2).shift(26)
-                                _sa_cur = float(_span_a.iloc[-1]) if pd.notna(_span_a.iloc[-1]) else 0
-                                _sb_cur = float(_span_b.iloc[-1]) if pd.notna(_span_b.iloc[-1]) else 0
-                                # 1) Price above Kumo
-                                ichimoku_above_kumo = current_price > max(_sa_cur, _sb_cur) > 0
-                                # 2) TK Cross bullish in last 5 bars
-                                for _i in range(-5, 0):
-                                    if (_tenkan.iloc[_i-1] <= _kijun.iloc[_i-1]
-                                            and _tenkan.iloc[_i] > _kijun.iloc[_i]):
-                                        ichimoku_tk_cross = True
-                                        break
-                                # 3) Future Kumo green (SpanA > SpanB at current shifted position)
-                                ichimoku_kumo_green = _sa_cur > _sb_cur and _sa_cur > 0
-                                # 4) Chikou Span clear (current close > close 26 bars ago)
-                                if len(df) >= 27:
-                                    ichimoku_chikou_ok = float(df['Close'].iloc[-1]) > float(df['Close'].iloc[-27])
-                                ichimoku_score_val = sum([ichimoku_above_kumo, ichimoku_tk_cross,
-                                                         ichimoku_kumo_green, ichimoku_chikou_ok])
-                        except Exception:
-                            pass
-
-                        # Price Pattern detection (ใช้ df ที่มีอยู่แล้ว)
-                        pattern_result = detect_price_pattern(df)
-                        pattern_name  = pattern_result['name']
-                        pattern_score = pattern_result['score']
-
-                        close_series = df['Close'].dropna()
-                        rel_1m = rel_3m = 0.0
-                        stock_3m_ret = 0.0
-                        if len(close_series) >= 66:
-                            stock_1m = float((close_series.iloc[-1] - close_series.iloc[-22]) / close_series.iloc[-22] * 100)
-                            stock_3m = float((close_series.iloc[-1] - close_series.iloc[-66]) / close_series.iloc[-66] * 100)
-                            stock_3m_ret = stock_3m
-                            rel_1m = round(stock_1m - set_1m_return, 2)
-                            rel_3m = round(stock_3m - set_3m_return, 2)
-                        elif len(close_series) >= 22:
-                            stock_1m = float((close_series.iloc[-1] - close_series.iloc[-22]) / close_series.iloc[-22] * 100)
-                            rel_1m = round(stock_1m - set_1m_return, 2)
-
-
-
-                        # ====== Advanced Precision Bonus/Penalty ======
-                        from stocks.utils import detect_vcp_pattern
-                        vcp = detect_vcp_pattern(df)
-                        vcp_setup_flag = vcp.get('setup', False)
-                        vcp_tightness_val = vcp.get('tightness', 999.0)
-                        
-                        inside_bar_flag = False
-                        if len(df) >= 2:
-                            c0 = df.iloc[-1]
-                            c1 = df.iloc[-2]
-                            inside_bar_flag = c0['High'] <= c1['High'] and c0['Low'] >= c1['Low']
-
-                        if vcp_setup_flag:
-                            integrated_score += 10
-                            if vcp_tightness_val <= 10:
-                                integrated_score += 5
-                        
-                        # Pocket Pivot
-                        if pp_at_ma50_flag:
-                            integrated_score += 15
-                        elif pocket_pivot_flag:
-                            integrated_score += 5
-                            
-                        # Turtle Breakout (จ่อเบรค)
-                        turtle_dist = tech.get('turtle_dist_pct', 99.0)
-                        if turtle_dist <= 2.0:
-                            integrated_score += 10
-                            
-                        # Wyckoff Dynamics
-                        if wyckoff_spring_flag:
-                            integrated_score += 10
-                        if wyckoff_upthrust_flag:
-                            integrated_score -= 20
-                        if wyckoff_er_warning_flag:
-                            _is_bear = (not rvol_bullish) or (tech.get('dist_days', 0) >= 3) or (tech.get('cmf', 0) < -0.1)
-                            if _is_bear:
-                                integrated_score -= 15
-                            else:
-                                integrated_score += 10
-                        if wyckoff_selling_climax_flag:
-                            integrated_score += 5
-                            
-                        # Inside Bar
-                        if inside_bar_flag:
-                            integrated_score += 5
-                            
-                        integrated_score = min(max(integrated_score, 0), 100)
-                        # Return dict instead of model to allow bulk fundamental enrichment and RS Ranking
-                        return {
-                            'symbol': symbol,
-                            'price': round(current_price, 2),
-                            'rsi': round(rsi, 2),
-                            'adx': round(adx_val, 2),
-                            'mfi': round(mfi_val, 2),
-                            'rvol': round(rvol, 2),
-                            'technical_score': int(integrated_score),
-                            'avg_volume_20d': round(avg_vol_20, 0),
-                            'rvol_bullish': rvol_bullish,
-                            'erc_volume_confirmed': erc_vol_confirmed,
-                            'zone_target_src': zone_target_src,
-                            'entry_strat': entry_strat,
-                            'dz_start': dz_start,
-                            'dz_end': dz_end,
-                            'sz_start': sz_start,
-                            'sz_end': sz_end,
-                            'sl_price': sl_price,
-                            'rr_val': rr_val,
-                            'year_high': round(year_high, 2),
-                            'upside_to_high': round(gap_to_high, 2),
-                            'prox_val': round(prox_val, 2),
-                            'pattern_name': pattern_name,
-                            'pattern_score': pattern_score,
-                            'rel_1m': rel_1m,
-                            'rel_3m': rel_3m,
-                            'macd_histogram': round(macd_hist_val, 4) if macd_hist_val is not None else None,
-                            'macd_crossover': macd_cross_val,
-                            'bb_squeeze': bb_squeeze_flag,
-                            'ema20_aligned': ema20_aligned_flag,
-                            'ema20_slope': round(ema20_slope_val, 3),
-                            'ema20_rising': ema20_rising_flag,
-                            'hh_hl_structure': hh_hl_flag,
-                            'stock_3m_ret': stock_3m_ret,
-                            'rs_rating': rs_ratings_map.get(symbol, 0),
-                            'stage2': stage2_flag,
-                            'pocket_pivot': pocket_pivot_flag,
-                            'pp_at_ma50': pp_at_ma50_flag,
-                            'wyckoff_spring': wyckoff_spring_flag,
-                            'wyckoff_upthrust': wyckoff_upthrust_flag,
-                            'wyckoff_effort_result_warning': wyckoff_er_warning_flag,
-                            'wyckoff_selling_climax': wyckoff_selling_climax_flag,
-                            'trend_template_score': tt_score_val,
-                            'trend_template_passed': tt_passed_flag,
-                            'cheat_entry': cheat_entry_flag,
-                            'ma10': round(ma10_val, 2),
-                            'ma50': round(ma50_val, 2),
-                            'vdu_near_zone': vdu_flag,
-                            'cmf': tech.get('cmf', 0.0),
-                            'is_52w_breakout': tech.get('is_52w_breakout', False),
-                            'volume_surge': tech.get('volume_surge', 1.0),
-                            'is_volume_surge': tech.get('is_volume_surge', False),
-                            'ichimoku_above_kumo': ichimoku_above_kumo,
-                            'ichimoku_tk_cross': ichimoku_tk_cross,
-                            'ichimoku_kumo_green': ichimoku_kumo_green,
-                            'ichimoku_chikou_ok': ichimoku_chikou_ok,
-                            'ichimoku_score': ichimoku_score_val,
-                            # ====== VCP Detection ======
-                            'vcp': vcp,
-                            # ====== Launcher Data (v10) ======
-                            'launcher_score': tech.get('launcher_score', 0),
-                            'turtle_dist_pct': tech.get('turtle_dist_pct', 99.0),
-                            'is_explosive': tech.get('is_explosive', False),
-                            'tightness_idx': tech.get('tightness_idx', 99.0),
-                            # ====== Pre-Breakout Signals (v13) ======
-                            'inside_bar': tech.get('inside_bar', False),
-                            'acc_days': tech.get('acc_days', 0),
-                            'dist_days': tech.get('dist_days', 0),
-
-                            # ====== John Ehlers Indicators (v12) ======
-                            'ehlers_supersmoother': tech.get('ehlers_supersmoother', current_price),
-                            'ehlers_laguerre_rsi': tech.get('ehlers_laguerre_rsi', 0.5),
-                            'ehlers_fisher': tech.get('ehlers_fisher', 0.0),
-                            'ehlers_fisher_trigger': tech.get('ehlers_fisher_trigger', 0.0),
-                            'ehlers_itl_daily': tech.get('ehlers_itl_daily', current_price),
-                            'ehlers_itl_weekly': tech.get('ehlers_itl_weekly', current_price),
-                            'ehlers_itl_bullish': tech.get('ehlers_itl_bullish', False),
-                            'vp_poc_price': tech.get('vp_poc_price', None),
-                            'vp_status': tech.get('vp_status') or '',
-                        }
-
-                    except Exception as e:
-                        import logging
-                        logging.getLogger('stocks').exception(f"[Precision] Error scanning {symbol}: {e}")
-                        return None
-
-
-                # ====== Phase 2: Deep Scan (only for candidates) ======
-                _cache.set(ckey, {'state': 'running', 'progress': 25, 'total': 100, 'phase': f'สแกนละเอียด (จำนวน {len(results_to_process)} ตัว)...'}, timeout=900)
-                
-                results = []
-                done_count = 0
-                with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-                    futures = [executor.submit(_process_precision_scan, sym) for sym in results_to_process]
-                    for future in concurrent.futures.as_completed(futures):
-                        res = future.result()
-                        if res:
-                            results.append(res)
-                        done_count += 1
-                        _cache.set(ckey, {'state': 'running', 'progress': 25 + int((done_count/len(results_to_process))*70), 
-                                          'total': 100, 'phase': f'สแกนละเอียด {done_count}/{len(results_to_process)}...'}, timeout=900)
-
-                if results:
-                    scan_df = pd.DataFrame(results)
-                    if 'rs_rating' not in scan_df.columns:
-                        scan_df['rs_rating'] = 0
-
-                    _cache.set(ckey, {'state': 'running', 'progress': 95, 'total': 100, 'phase': 'ดึงข้อมูล Fundamental…'}, timeout=900)
-
-                    # ====== Bulk Fundamental Enrichment ======
-                    matched_symbols = [r['symbol'] for r in results]
-                    symbols_bk = matched_symbols
-                    fund_data = {}
-                    try:
-                        yq_all = YQTicker(symbols_bk)
-                        modules = yq_all.get_modules('financialData summaryProfile defaultKeyStatistics')
-                        for sym_bk, data in modules.items():
-                            if not isinstance(data, dict):
-                                continue
-                            clean_sym = sym_bk
-                            profile  = data.get('summaryProfile', {})
-                            fin_data = data.get('financialData', {})
-                            keystat  = data.get('defaultKeyStatistics', {})
-                            sector   = (
-                                profile.get('sector')
-                                or data.get('assetProfile', {}).get('sector')
-                                or 'Unknown'
-                            )
-                            eps_g = keystat.get('earningsQuarterlyGrowth') or fin_data.get('earningsGrowth') or 0.0
-                            eps_growth = float(eps_g) * 100
-                            rev_growth = float(fin_data.get('revenueGrowth', 0) or 0) * 100
-                            fund_data[clean_sym] = {'sector': sector, 'eps_growth': eps_growth, 'rev_growth': rev_growth}
-                    except Exception as e:
-                        print(f"[Precision] Bulk Fundamental fetch failed: {e}")
-
-                    # ====== Sector Confirmation (Livermore "Leading Sisters") ======
-                    # หุ้นกลุ่มเดียวกันควรขยับไปด้วยกัน — ถ้าหุ้นตัวนำวิ่งเดี่ยวๆ แต่กลุ่มไม่ขยับ มีโอกาสเป็นสัญญาณหลอกสูงขึ้น
-                    sector_stage2_ratio = {}
-                    try:
-                        from collections import defaultdict
-                        _sec_total = defaultdict(int)
-                        _sec_stage2 = defaultdict(int)
-                        for _rec in scan_df.to_dict('records'):
-                            _sec = fund_data.get(_rec['symbol'], {}).get('sector') or 'Unknown'
-                            _sec_total[_sec] += 1
-                            if _rec.get('stage2'):
-                                _sec_stage2[_sec] += 1
-                        for _sec, _tot in _sec_total.items():
-                            sector_stage2_ratio[_sec] = round(_sec_stage2[_sec] / _tot * 100, 1) if _tot else 0.0
-                    except Exception:
-                        pass
-
-                    # ====== Bulk Create ======
-                    bulk_candidates = []
-                    for r in scan_df.to_dict('records'):
-                        sym = r['symbol']
-                        f = fund_data.get(sym, {'sector': 'N/A', 'eps_growth': 0.0, 'rev_growth': 0.0})
-                        _sec = f.get('sector') or 'Unknown'
-                        _sec_pct = sector_stage2_ratio.get(_sec, 0.0)
-                        bulk_candidates.append(PrecisionScanCandidate(
-                            user=user,
-                            market='US',
-                            scan_run=scan_run_time,
-                            symbol=sym,
-                            symbol_bk=sym,
-                            sector=_sec,
-                            trend_template_score=r.get('trend_template_score', 0),
-                            trend_template_passed=r.get('trend_template_passed', False),
-                            cheat_entry=r.get('cheat_entry', False),
-                            sector_confirmed=_sec_pct >= 30.0,
-                            sector_strength_pct=_sec_pct,
-                            price=r['price'],
-                            rsi=r['rsi'],
-                            adx=r['adx'],
-                            mfi=r['mfi'],
-                            rvol=r['rvol'],
-                            eps_growth=round(f.get('eps_growth', 0), 2),
-                            rev_growth=round(f.get('rev_growth', 0), 2),
-                            technical_score=r['technical_score'],
-                            rs_rating=r['rs_rating'],
-                            avg_volume_20d=r['avg_volume_20d'],
-                            rvol_bullish=r['rvol_bullish'],
-                            erc_volume_confirmed=r['erc_volume_confirmed'],
-                            zone_target_source=r['zone_target_src'],
-                            is_new_entry=(sym not in prev_symbols),
-                            entry_strategy=r['entry_strat'],
-                            demand_zone_start=r['dz_start'],
-                            demand_zone_end=r['dz_end'],
-                            supply_zone_start=r['sz_start'],
-                            supply_zone_end=r['sz_end'],
-                            stop_loss=r['sl_price'],
-                            risk_reward_ratio=r['rr_val'],
-                            year_high=r['year_high'],
-                            upside_to_high=r['upside_to_high'],
-                            zone_proximity=r['prox_val'],
-                            price_pattern=r['pattern_name'],
-                            price_pattern_score=r['pattern_score'],
-                            rel_momentum_1m=r['rel_1m'],
-                            rel_momentum_3m=r['rel_3m'],
-                            macd_histogram=r['macd_histogram'],
-                            macd_crossover=r['macd_crossover'],
-                            bb_squeeze=r['bb_squeeze'],
-                            ema20_aligned=r['ema20_aligned'],
-                            ema20_slope=r.get('ema20_slope', 0.0),
-                            ema20_rising=r.get('ema20_rising', False),
-                            hh_hl_structure=r.get('hh_hl_structure', False),
-                            stage2=r.get('stage2', False),
-                            pocket_pivot=r.get('pocket_pivot', False),
-                            pp_at_ma50=r.get('pp_at_ma50', False),
-                            wyckoff_spring=r.get('wyckoff_spring', False),
-                            wyckoff_upthrust=r.get('wyckoff_upthrust', False),
-                            wyckoff_effort_result_warning=r.get('wyckoff_effort_result_warning', False),
-                            wyckoff_selling_climax=r.get('wyckoff_selling_climax', False),
-                            ma10=r.get('ma10', 0.0),
-                            ma50=r.get('ma50', 0.0),
-                            vdu_near_zone=r.get('vdu_near_zone', False),
-                            cmf=r.get('cmf', None),
-                            is_52w_breakout=r.get('is_52w_breakout', False),
-                            volume_surge=r.get('volume_surge', 1.0),
-                            is_volume_surge=r.get('is_volume_surge', False),
-                            ichimoku_above_kumo=r.get('ichimoku_above_kumo', False),
-                            ichimoku_tk_cross=r.get('ichimoku_tk_cross', False),
-                            ichimoku_kumo_green=r.get('ichimoku_kumo_green', False),
-                            ichimoku_chikou_ok=r.get('ichimoku_chikou_ok', False),
-                            ichimoku_score=r.get('ichimoku_score', 0),
-                            # VCP v9
-                            vcp_setup=r.get('vcp', {}).get('setup', False),
-                            vcp_contractions=r.get('vcp', {}).get('contractions', 0),
-                            vcp_tightness=r.get('vcp', {}).get('tightness', 0.0),
-                            vcp_vdu=r.get('vcp', {}).get('vdu_confirmed', False),
-                            base_length_weeks=r.get('vcp', {}).get('base_length_weeks', 0),
-                            # Launcher v10
-                            launcher_score=r.get('launcher_score', 0),
-                            turtle_dist_pct=r.get('turtle_dist_pct', 99.0),
-                            is_explosive=r.get('is_explosive', False),
-                            tightness_idx=r.get('tightness_idx', 99.0),
-                            # Pre-Breakout Signals v13
-                            inside_bar=r.get('inside_bar', False),
-                            acc_days=r.get('acc_days', 0),
-                            dist_days=r.get('dist_days', 0),
-                            # Ehlers v12
-                            ehlers_supersmoother=r.get('ehlers_supersmoother', None),
-                            ehlers_laguerre_rsi=r.get('ehlers_laguerre_rsi', None),
-                            ehlers_fisher=r.get('ehlers_fisher', None),
-                            ehlers_fisher_trigger=r.get('ehlers_fisher_trigger', None),
-                            ehlers_itl_daily=r.get('ehlers_itl_daily', None),
-                            ehlers_itl_weekly=r.get('ehlers_itl_weekly', None),
-                            ehlers_itl_bullish=r.get('ehlers_itl_bullish', False),
-                            vp_poc_price=r.get('vp_poc_price'),
-                            vp_status=r.get('vp_status') or '',
-                        ))
-
-                    if bulk_candidates:
-                        PrecisionScanCandidate.objects.bulk_create(bulk_candidates)
-
-                # เก็บประวัติแค่ 3 "วัน" ล่าสุด (ไม่ใช่ 3 "ครั้ง" ล่าสุด) — ถ้าเดิมนับเป็นจำนวนครั้ง คนที่สแกนวันละ
-                # หลายรอบจะไล่ลบประวัติของวันก่อนๆ หมดภายในวันเดียว ทำให้ POC Trend ไม่มีทางข้ามวันได้เลย
-                _all_run_ts = list(
-                    PrecisionScanCandidate.objects
-                    .filter(user=user, market='US')
-                    .values_list('scan_run', flat=True)
-                    .order_by('-scan_run')
-                    .distinct()
-                )
-                _seen_dates = []
-                for _ts in _all_run_ts:
-                    _d = tz.localtime(_ts).date()
-                    if _d not in _seen_dates:
-                        _seen_dates.append(_d)
-                if len(_seen_dates) > 3:
-                    _cutoff_date = _seen_dates[2]  # วันที่เก่าที่สุดใน 3 วันที่จะเก็บไว้
-                    old_runs = [_ts for _ts in _all_run_ts if tz.localtime(_ts).date() < _cutoff_date]
-                    if old_runs:
-                        PrecisionScanCandidate.objects.filter(user=user, market='US', scan_run__in=old_runs).delete()
-
-                _cache.set(ckey, {'state': 'done', 'count': len(results)}, timeout=300)
-
-            except Exception as _bg_err:
-                import logging
-                logging.getLogger('stocks').exception(f"[PrecisionBG] Error: {_bg_err}")
-                from django.core.cache import cache as _ec
-                _ec.set(ckey, {'state': 'idle'}, timeout=60)
-
-        # เปิด background thread แล้ว return ทันที
-        _t = threading.Thread(
-            target=_run_precision_bg,
-            args=(user_id, cache_key),
-            daemon=True
-        )
-        _t.start()
-
-        # Redirect กลับหน้าที่ส่งมา (เช่น SEPA) - next_url resolve ไว้แล้วด้านบน
-        return redirect(next_url)
-
-    # ====== จัดเรียงผลลัพธ์ ======
-    sort_by = request.GET.get('sort', 'score')
-    valid_db_sorts = {
-        'symbol': 'symbol',
-        'score': '-technical_score',
-        'price': '-price',
-        'rsi': '-rsi',
-        'rvol': '-rvol',
-        'adx': '-adx',
-        'prox': 'zone_proximity',
-        'round_rr': '-risk_reward_ratio',
-        'rs': '-rs_rating',          # RS Rating (Minervini Relative Strength)
-        'launcher': '-launcher_score', # Explosive Launcher Score
-        'cmf': '-cmf',                # Chaikin Money Flow (Institutional Accumulation)
-    }
-    use_db_sort = sort_by in valid_db_sorts
-    order_field = valid_db_sorts.get(sort_by, '-technical_score')
-
-    # รายชื่อ scan runs ทั้งหมด (index 0 = ล่าสุด)
-    all_runs = list(
-        PrecisionScanCandidate.objects
-        .filter(user=request.user, market='US')
-        .values_list('scan_run', flat=True)
-        .order_by('-scan_run')
-        .distinct()
-    )
-
-    # เลือกรอบสแกนตาม ?run_idx= (0 = ล่าสุด, 1 = ก่อนหน้า, ...)
-    try:
-        run_idx = int(request.GET.get('run_idx', 0))
-    except (ValueError, TypeError):
-        run_idx = 0
-    run_idx = max(0, min(run_idx, len(all_runs) - 1)) if all_runs else 0
-
-    candidates = []
-    scanned_at = None
-    if all_runs:
-        selected_run = all_runs[run_idx]
-        qs = PrecisionScanCandidate.objects.filter(user=request.user, scan_run=selected_run, market='US')
-        if use_db_sort:
-            qs = qs.order_by(order_field)
-        candidates = list(qs)
-        scanned_at = selected_run
-
-        # ====== Live Price Fetch (ถ้าตลาดเปิด) - แสดงราคาปัจจุบันคู่กับราคา close เมื่อวาน ======
-        # Indicator ยังคำนวณจาก settled close (คงที่), live price ใช้แสดงเท่านั้น
-        from datetime import datetime as _ldt
-        from datetime import time as _ldtime
-
-        import pytz as _lpytz
-        _lbkk = _lpytz.timezone('Asia/Bangkok')
-        _lnow = _ldt.now(_lbkk)
-        _lt = _lnow.time()
-        # Live price: เฉพาะช่วงที่ตลาด SET ซื้อขายจริง (ไม่รวม midday break 12:30-14:30)
-        _lmarket_open = (
-            _lnow.weekday() < 5 and
-            (_ldtime(10, 0) <= _lt <= _ldtime(12, 30) or
-             _ldtime(14, 30) <= _lt <= _ldtime(16, 30))
-        )
-        live_prices = {}
-        live_mcaps  = {}
-        live_prev_closes = {}
-        if candidates:
-            try:
-                # แคชผล fetch ไว้ - กันยิง yfinance เท่าจำนวนหุ้นทุกครั้งที่ refresh หน้า
-                # ตลาดเปิด: 60s (ราคาขยับ), ตลาดปิด: 10 นาที (ราคา close ไม่เปลี่ยน)
-                from django.core.cache import cache as _lp_cache
-                _lp_key = f'precision_live_set_{request.user.id}_{run_idx}'
-                _lp_cached = _lp_cache.get(_lp_key)
-                if _lp_cached:
-                    if isinstance(_lp_cached, tuple) and len(_lp_cached) == 3:
-                        live_prices, live_mcaps, live_prev_closes = _lp_cached
-                    elif isinstance(_lp_cached, tuple) and len(_lp_cached) == 2:
-                        live_prices, live_mcaps = _lp_cached
-                        live_prev_closes = {}
-                    else:
-                        live_prices, live_mcaps, live_prev_closes = {}, {}, {}
-                else:
-                    import concurrent.futures as _lcf
-                    def _get_live(sym):
-                        try:
-                            full_sym = sym
-                            # Use fast_info for quick price/mcap without downloading full history
-                            fi = yf.Ticker(full_sym).fast_info
-                            p  = getattr(fi, 'last_price', None)
-                            mc = getattr(fi, 'market_cap', None)
-                            pc = getattr(fi, 'regular_market_previous_close', getattr(fi, 'previous_close', None))
-                            return (
-                                sym,
-                                (float(p) if p else None),
-                                (round(float(mc)/1e9, 2) if mc else None),
-                                (float(pc) if pc else None)
-                            )
-                        except Exception:
-                            return sym, None, None, None
-                    with _lcf.ThreadPoolExecutor(max_workers=6) as _lex:
-                        for _sym, _p, _mc, _pc in _lex.map(_get_live, [c.symbol for c in candidates]):
-                            if _p:  live_prices[_sym] = _p
-                            if _mc: live_mcaps[_sym]  = _mc
-                            if _pc: live_prev_closes[_sym] = _pc
-                    if live_prices:
-                        _lp_cache.set(_lp_key, (live_prices, live_mcaps, live_prev_closes), 60 if _lmarket_open else 600)
-            except Exception:
-                pass
-
-        for c in candidates:
-            lp = live_prices.get(c.symbol)
-            pc = live_prev_closes.get(c.symbol) or c.price
-            c.live_price      = lp
-            c.live_market_cap = live_mcaps.get(c.symbol)
-            c.is_live         = _lmarket_open and lp is not None
-
-            ref_price = lp if lp else float(c.price or 0)
-            dz_top = float(c.demand_zone_start or 0)
-            dz_bot = float(c.demand_zone_end   or 0)
-            tp     = float(c.supply_zone_start or 0)
-
-            if lp and dz_top > 0:
-                c.live_zone_prox = 0.0 if lp <= dz_top else round(((lp - dz_top) / dz_top) * 100, 1)
-            else:
-                c.live_zone_prox = None
-            if lp and pc and float(pc) > 0:
-                c.live_change_pct = round(((lp - float(pc)) / float(pc)) * 100, 2)
-            else:
-                c.live_change_pct = None
-
-            # precompute zone status flags - ใช้ใน template แทนการคำนวณใน {% if %}
-            c.live_at_tp      = tp > 0 and ref_price >= tp
-            c.live_broke_zone = dz_bot > 0 and ref_price < dz_bot
-            c.live_in_zone    = dz_top > 0 and dz_bot > 0 and dz_bot <= ref_price <= dz_top
-
-            # upside_to_tp: % ของ range Entry→TP ที่ยังเหลืออยู่
-            entry = dz_top
-            total_range = tp - entry
-            if tp > 0 and entry > 0 and total_range > 0 and ref_price > 0:
-                remaining = tp - ref_price
-                c.upside_to_tp = round((remaining / total_range) * 100, 1)
-            else:
-                c.upside_to_tp = 999
-
-        # ====== คำนวณ BUY/SELL Score ด้วย _compute_signals() เดียวกับ Dashboard/Watchlist ======
-        for c in candidates:
-            sigs = _compute_signals(c)
-            c.buy_score  = sigs['buy_score']
-            c.sell_score = sigs['sell_score']
-            c.exit_signal = sigs['exit_signal']
-            c.reversal_score = sigs['reversal_score']
-            c.reversal_alert = sigs['reversal_alert']
-            c.reversal_color = sigs['reversal_color']
-
-        # ====== BUY Score Delta เทียบกับรอบก่อนหน้า ======
-        prev_buy_scores = {}
-        if len(all_runs) > run_idx + 1:
-            for _p in PrecisionScanCandidate.objects.filter(
-                    user=request.user, scan_run=all_runs[run_idx + 1]):
-                _ps = _compute_signals(_p)
-                prev_buy_scores[_p.symbol] = _ps['buy_score']
-        for c in candidates:
-            _prev = prev_buy_scores.get(c.symbol)
-            c.buy_score_delta = (c.buy_score - _prev) if _prev is not None else None
-
-        # ====== POC Trend — ลำดับสถานะ Volume Profile (POC) ของแต่ละหุ้น สูงสุด 3 "วัน" ล่าสุด (เก่า→ใหม่) ======
-        # ใช้รอบล่าสุดของแต่ละวัน ไม่ใช่ all_runs[run_idx:run_idx+3] ตรงๆ เพราะถ้าสแกนถี่ในวันเดียว
-        # 3 รอบล่าสุดอาจเป็นวันเดียวกันหมด ทำให้ trend ไม่มีทางข้ามวันไปเห็นการเปลี่ยนแปลงจริง
-        vp_trend_map = {}
-        if len(all_runs) > 1:
-            _day_to_run = {}
-            for _ts in all_runs[run_idx:]:
-                _d = tz.localtime(_ts).date()
-                if _d not in _day_to_run:
-                    _day_to_run[_d] = _ts
-                if len(_day_to_run) >= 3:
-                    break
-            trend_run_ids = list(_day_to_run.values())
-            _vp_by_symbol = {}
-            for row in PrecisionScanCandidate.objects.filter(
-                    user=request.user, market='US', scan_run__in=trend_run_ids
-            ).values('symbol', 'scan_run', 'vp_status'):
-                if not row['vp_status']:
-                    continue
-                _vp_by_symbol.setdefault(row['symbol'], []).append((row['scan_run'], row['vp_status']))
-            for sym, entries in _vp_by_symbol.items():
-                entries.sort(key=lambda x: x[0])  # เก่า → ใหม่
-                statuses = [e[1] for e in entries]
-                if len(statuses) > 1:
-                    vp_trend_map[sym] = statuses
-        for c in candidates:
-            c.vp_trend = vp_trend_map.get(c.symbol)
-
-    # ====== Markov Market Regime (v11) ======
-    from django.core.cache import cache as _regime_cache
-
-    from stocks.utils import calculate_markov_regime
-
-    _regime_key = 'markov_regime_set'
-    markov_regime = _regime_cache.get(_regime_key)
-
-    if not markov_regime:
-        markov_regime = calculate_markov_regime("SPY", window=60)
-        _regime_cache.set(_regime_key, markov_regime, 1800) # 30 min cache
-
-    # ====== Win Probability Calculation (v11.1) ======
-    if candidates:
-        m_state = markov_regime.get('state', 'UNKNOWN')
-        m_prob = markov_regime.get('prob', 0) / 100.0
-        for c in candidates:
-            score = 35.0
-            rs_val = getattr(c, 'rs_rating', 0) or 0
-            score += (rs_val / 99.0) * 25.0
-            tech_val = getattr(c, 'technical_score', 0) or 0
-            score += (min(tech_val, 100) / 100.0) * 15.0
-            adx_val = getattr(c, 'adx', 0) or 0
-            score += (min(adx_val, 50) / 50.0) * 10.0
-            cmf_val = getattr(c, 'cmf', 0) or 0
-            vol_surge = getattr(c, 'volume_surge', 1.0) or 1.0
-            if cmf_val > 0.15: score += 10.0
-            elif cmf_val > 0: score += 5.0
-            if vol_surge >= 1.5: score += 5.0
-            elif vol_surge >= 1.2: score += 2.0
-            if m_state == 'TRENDING': score += 10.0 * (0.5 + 0.5 * m_prob)
-            elif m_state == 'CHOPPY': score += 4.0
-            elif m_state == 'UNKNOWN' and m_prob == 0: score += 5.0
-            prox = getattr(c, 'live_zone_prox', None)
-            if prox is None:
-                prox = getattr(c, 'zone_proximity', 99.0)
-            if prox is None:
-                prox = 99.0
-            if prox > 15 and prox < 100: score -= 10.0
-            elif prox > 10 and prox < 100: score -= 5.0
-            c.win_probability = round(max(min(score, 98.2), 30.0), 1)
-
-        # เรียงตาม BUY/SELL/RS score ด้วย Python (fallback ถ้าไม่ใช่ DB sort)
-        if sort_by == 'buy':
-            candidates.sort(key=lambda x: x.buy_score, reverse=True)
-        elif sort_by == 'sell':
-            candidates.sort(key=lambda x: x.sell_score, reverse=True)
-        elif sort_by == 'rs':
-            candidates.sort(key=lambda x: getattr(x, 'rs_rating', 0), reverse=True)
-        elif sort_by == 'win':
-            candidates.sort(key=lambda x: getattr(x, 'win_probability', 0), reverse=True)
-
-        # ====== Top 5 หุ้นแนะนำซื้อ (BUY score สูง) ======
-        # เงื่อนไข: RVOL Bull ≥ 1.0x (มีแรงซื้อจริง) + RSI ไม่ overbought
-        def _top5_filter(min_rvol, max_rsi=85):
-            # max_rsi=85 สอดคล้องกับ _compute_signals ที่ยังให้ +2 กับ RSI 80-85
-            return sorted(
-                [c for c in candidates
-                 if c.buy_score >= 50
-                 and c.rvol_bullish
-                 and c.rvol >= min_rvol
-                 and c.rsi <= max_rsi
-                 and not (c.demand_zone_end and float(getattr(c, 'live_price', None) or c.price or 0) < float(c.demand_zone_end))],
-                key=lambda x: x.buy_score, reverse=True
-            )[:5]
-
-        top5_buy = _top5_filter(1.0)
-        if len(top5_buy) < 5:
-            top5_buy = _top5_filter(0.7)
-        if len(top5_buy) < 3:
-            top5_buy = _top5_filter(0.0)
-
-        # ====== Top 5 หุ้นที่ "ผ่านเกณฑ์ครบทุกข้อ" ======
-        # ผ่อนปรนเกณฑ์ ADX 20 (เดิม 25) และ RSI ขยายเพื่อให้มีตัวเลือกมากขึ้น 
-        def _is_fully_qualified(c):
-            rr = c.risk_reward_ratio or 0
-            dz_start = float(c.demand_zone_start or 0)
-            dz_end   = float(c.demand_zone_end   or 0)
-            # ใช้ live price ถ้ามี เพราะ zone_proximity ใน DB เป็นค่า ณ เวลาสแกน
-            price    = float(getattr(c, 'live_price', None) or c.price or 0)
-            live_prox = getattr(c, 'live_zone_prox', None)
-            effective_prox = live_prox if live_prox is not None else c.zone_proximity
-            in_zone  = dz_start > 0 and dz_end > 0 and dz_end <= price <= dz_start
-            above_zone = price > dz_start and effective_prox <= 30
-            near_zone  = in_zone or above_zone
-            # ตัดหุ้นที่ราคาหลุดต่ำกว่า demand zone (ทะลุ SL) - ไม่ใช่จุดซื้อแล้ว
-            broke_zone = dz_end > 0 and price < dz_end
-            # ตัดหุ้นที่ราคาวิ่งขึ้นเกือบถึง/เกิน target แล้ว
-            target = c.supply_zone_start or 0
-            upside_pct = ((target - price) / price * 100) if (target > 0 and price > 0) else 999
-            price_near_target = target > 0 and upside_pct < 8
-            return (
-                c.buy_score >= 65
-                and rr >= 1.5
-                and c.adx >= 20
-                and 45 <= c.rsi <= 82
-                and c.rvol_bullish
-                and c.rvol >= 0.8
-                and near_zone
-                and not broke_zone             # กรอง: ราคาหลุดต่ำกว่า zone (ทะลุ SL)
-                and not price_near_target      # กรอง: ราคาใกล้ target แล้ว
-                and (c.sell_score or 0) < 50
-                and getattr(c, 'rs_rating', 0) >= 60
-            )
-
-        top5_qualified = sorted(
-            [c for c in candidates if _is_fully_qualified(c)],
-            key=lambda x: x.buy_score, reverse=True
-        )
-
-        for c in top5_buy:
-            reasons = []
-            in_zone = (c.demand_zone_start and c.demand_zone_end and
-                       c.price <= c.demand_zone_start and c.price >= c.demand_zone_end)
-            if in_zone:
-                reasons.append("อยู่ใน Entry Zone แล้ว")
-            elif c.zone_proximity <= 10:
-                reasons.append(f"เหนือโซน {c.zone_proximity:.0f}% (รอย่อ)")
-            elif c.zone_proximity <= 30:
-                reasons.append(f"เหนือโซน {c.zone_proximity:.0f}%")
-
-            if c.rvol_bullish and c.rvol >= 1.5:
-                reasons.append(f"RVOL {c.rvol:.1f}x Bull แรง")
-            elif c.rvol_bullish and c.rvol >= 1.0:
-                reasons.append(f"RVOL {c.rvol:.1f}x Bull ยืนยัน")
-
-            rr = c.risk_reward_ratio or 0
-            if rr >= 3:
-                reasons.append(f"RR 1:{rr:.1f} ดีเยี่ยม")
-            elif rr >= 2:
-                reasons.append(f"RR 1:{rr:.1f} ดี")
-
-            if c.adx >= 30:
-                reasons.append(f"ADX {c.adx:.0f} เทรนด์แข็ง")
-            elif c.adx >= 25:
-                reasons.append(f"ADX {c.adx:.0f} มีเทรนด์")
-
-            if c.technical_score >= 85:
-                reasons.append(f"Precision {c.technical_score} สูงมาก")
-            elif c.technical_score >= 75:
-                reasons.append(f"Precision {c.technical_score} ดี")
-
-            if c.erc_volume_confirmed:
-                reasons.append("ERC ยืนยันแล้ว")
-
-            if 55 <= c.rsi <= 70:
-                reasons.append(f"RSI {c.rsi:.0f} จุดหวาน")
-
-            if c.price_pattern and c.price_pattern_score > 0:
-                reasons.append(f"Pattern: {c.price_pattern}")
-
-            rel = c.rel_momentum_3m if c.rel_momentum_3m != 0.0 else c.rel_momentum_1m
-            if rel >= 8:
-                reasons.append(f"ชนะ SET +{rel:.1f}% (3m)")
-            elif rel >= 3:
-                reasons.append(f"ชนะ SET +{rel:.1f}%")
-
-            rs = getattr(c, 'rs_rating', 0)
-            if rs >= 85:
-                reasons.insert(1, f"RS {rs} - ผู้นำตลาด")   # สอดในตำแหน่ง 2 เสมอ
-            elif rs >= 70:
-                reasons.insert(1, f"RS {rs} - แข็งแกร่ง")
-
-            c.top_reasons = reasons[:4]
-
-        # เพิ่ม reasons ให้ top5_qualified ด้วย (บางตัวอาจซ้ำกับ top5_buy)
-        for c in top5_qualified:
-            if not hasattr(c, 'top_reasons'):
-                reasons = []
-                in_zone = (c.demand_zone_start and c.demand_zone_end and
-                           c.price <= c.demand_zone_start and c.price >= c.demand_zone_end)
-                if in_zone:
-                    reasons.append("อยู่ใน Entry Zone แล้ว")
-                elif c.zone_proximity <= 10:
-                    reasons.append(f"เหนือโซน {c.zone_proximity:.0f}% (รอย่อ)")
-                else:
-                    reasons.append(f"เหนือโซน {c.zone_proximity:.0f}%")
-                rr = c.risk_reward_ratio or 0
-                reasons.append(f"RR 1:{rr:.1f} ✓")
-                reasons.append(f"ADX {c.adx:.0f} ✓")
-                rs = getattr(c, 'rs_rating', 0)
-                if rs >= 85:
-                    reasons.insert(1, f"RS {rs} - ผู้นำตลาด")
-                elif rs >= 70:
-                    reasons.insert(1, f"RS {rs} - แข็งแกร่ง")
-                if c.rvol >= 1.5:
-                    reasons.append(f"RVOL {c.rvol:.1f}x Bull ✓")
-                c.top_reasons = reasons[:4]
-
-        # ====== Leading Sectors Analysis (v3) ======
-        # นับจำนวนหุ้นที่ 'แข็งแกร่ง' (buy_score >= 65) ในแต่ละ sector เพื่อหาผู้นำกลุ่ม
-        sector_counts = {}
-        for c in candidates:
-            if c.buy_score >= 65:
-                sec = c.sector or 'Unknown'
-                sector_counts[sec] = sector_counts.get(sec, 0) + 1
-        
-        # เรียงลำดับกลุ่มที่แข็งแกร่งที่สุด 5 อันดับแรก
-        top_sectors = sorted(
-            [{'name': k, 'count': v} for k, v in sector_counts.items()],
-            key=lambda x: x['count'], reverse=True
-        )[:5]
-
-        # ====== Automated AI Insights (คำอธิบายวิเคราะห์ผลสแกน) ======
-        scan_insights = []
-        if top5_qualified:
-            best_setup = top5_qualified[0]
-            rr_val = best_setup.risk_reward_ratio or 0
-            rs_val = getattr(best_setup, "rs_rating", 0)
-            target_val = best_setup.supply_zone_start or 0
-            upside_left = ((target_val - best_setup.price) / best_setup.price * 100) if (target_val > 0 and best_setup.price > 0) else 0
-            scan_insights.append({
-                'icon': '🏆',
-                'title': f'โฟกัสหลัก: {best_setup.symbol} (หน้าเทรดคุ้มค่า ปลอดภัยสูง)',
-                'desc': f'ถือเป็นหน้าเทรด Swing Trade ที่สมบูรณ์แบบที่สุดในรอบนี้ เพราะมีความแข็งแกร่ง (RS {rs_val}) เทรนด์ทำมุมสวยงาม แต่ราคาปัจจุบันกลับอยู่ใกล้จุดเข้าซื้อ ทำให้มีความคุ้มค่ากับความเสี่ยงสูง (RR 1:{rr_val:.1f}) Upside เหลืออีก {upside_left:.1f}% ถึง Target ซื้อแล้วมีโอกาสชนะสูง'
-            })
-        
-        # หาหุ้นซิ่งที่สุดแต่เสี่ยงสูง (RS > 90 แต่ RR < 1.0)
-        high_risk_momentum = [c for c in top5_buy if getattr(c, 'rs_rating', 0) >= 90 and (c.risk_reward_ratio or 0) < 1.5]
-        if high_risk_momentum:
-            hm = high_risk_momentum[0]
-            if not top5_qualified or hm.symbol != top5_qualified[0].symbol:
-                scan_insights.append({
-                    'icon': '🚀',
-                    'title': f'สายซิ่ง (เสี่ยงสูง): {hm.symbol} (แรงทะลุกราฟ)',
-                    'desc': f'นี่คือ "หุ้นโคตรโมเมนตัม" วิ่งแรงชนะตลาดถึง {getattr(hm, "rs_rating", 0)}% วอลุ่มเข้าหนัก แต่อัตราคุ้มทุน (RR) ณ ราคานี้ได้เพียง 1:{hm.risk_reward_ratio or 0:.1f} แปลว่าราคาลอยขึ้นมาพอสมควรแล้ว "อย่าเพิ่งไล่ราคา (Market Buy) แนะนำให้เอาเข้า Watchlist แล้วรอซื้อตอนย่อตัวพักฐาน"'
-                })
-
-        # หาหุ้นเพิ่งเริ่มกลับตัว (MACD crossover)
-        reversal_stocks = [c for c in top5_buy if getattr(c, 'macd_crossover', False)]
-        if reversal_stocks and len(scan_insights) < 3:
-            rev = reversal_stocks[0]
-            skip = False
-            if top5_qualified and rev.symbol == top5_qualified[0].symbol: skip = True
-            if high_risk_momentum and rev.symbol == high_risk_momentum[0].symbol: skip = True
-            if not skip:
-                scan_insights.append({
-                    'icon': '🥈',
-                    'title': f'สัญญาณกลับตัว: {rev.symbol} (ต้นเทรนด์)',
-                    'desc': f'หุ้นตัวนี้มีสัญญาณเชิงบวกคือเกิด MACD Crossover (ตัดเส้น Signal ขึ้นมา) มักใช้ระบุจุดเริ่มต้นของรอบขาขึ้นชุดใหม่ น่าเก็บสะสมที่บริเวณแนวรับปัจจุบัน'
-                })
-        
-        # ถ้าระบบยังไม่มีคำแนะนำเลย
-        if not scan_insights and top5_buy:
-            top = top5_buy[0]
-            scan_insights.append({
-                'icon': '💡',
-                'title': f'น่าปั้นเทรนด์: {top.symbol}',
-                'desc': f'ได้คะแนนเข้าซื้อสูงสุดในรอบนี้ มีโครงสร้างทางเทคนิคโดยรวมเฉลี่ยดีที่สุด เหมาะเป็นหุ้นน่าจับตามอง'
-            })
-
-    else:
-        top5_buy = []
-        top5_qualified = []
-        top_sectors = []
-        scan_insights = []
-
-    # ====== Market Condition - ดึงข้อมูล SET Index สำหรับแสดงผล (GET + POST) ======
-    from django.core.cache import cache as _mcache
-    market_condition_key = 'market_condition_set'
-    market_condition = _mcache.get(market_condition_key)
-    if not market_condition:
-        market_condition = {'phase': 'UNKNOWN', 'label': 'ไม่มีข้อมูล', 'color': 'secondary', 'score': 0}
-        try:
-            from datetime import datetime as _mcdt
-            from datetime import timedelta as _mctd
-
-            import pytz as _mcpytz
-            _mc_bkk   = _mcpytz.timezone('Asia/Bangkok')
-            _mc_now   = _mcdt.now(_mc_bkk)
-            _mc_end   = _mc_now.date().strftime('%Y-%m-%d')
-            _mc_start = (_mc_now.date() - _mctd(days=430)).strftime('%Y-%m-%d')
-            _mc_df = yf.download("SPY", start=_mc_start, end=_mc_end, interval="1d", progress=False)
-            if _mc_df is not None and not _mc_df.empty:
-                if isinstance(_mc_df.columns, pd.MultiIndex):
-                    _mc_df.columns = _mc_df.columns.droplevel(1)
-                market_condition = _get_market_condition(_mc_df)
-                _mcache.set(market_condition_key, market_condition, 1800) # 30 min cache
-        except Exception:
-            pass
-        if market_condition.get('phase') == 'UNKNOWN':
-            # ดึงไม่สำเร็จ - cache ค่า default สั้นๆ กัน yf.download 430 วันซ้ำทุก request
-            _mcache.set(market_condition_key, market_condition, 300)
-
-    context = {
-        'title': 'US Precision Momentum Scanner - กรองคุณภาพ',
-        'candidates': candidates,
-        'scanned_at': scanned_at,
-        'current_sort': sort_by,
-        'all_runs': all_runs,
-        'selected_run_idx': run_idx,
-        'has_scanned': request.method == "POST" or request.GET.get('scan') == 'true' or bool(all_runs),
-        'top5_buy': top5_buy,
-        'top5_qualified': top5_qualified,
-        'scan_total': len(scan_symbols),
-        'scan_passed': len(candidates),
-        'top_sectors': top_sectors,
-        'scan_insights': scan_insights,
-        'scan_data_date': None,  # คำนวณด้านล่าง
-        'market_condition': market_condition,
-        'markov_regime': markov_regime,
-    }
-    # คำนวณ scan_data_date จาก scanned_at - ถ้า scan ทำหลัง 16:30 BKK ข้อมูลคือวันเดียวกัน
-    # ถ้า scan ทำระหว่าง 10:00-16:30 (ตลาดเปิด) ข้อมูลจะเป็นวันก่อนหน้า
-    if scanned_at:
-        import pytz as _sddtz
-        _bkk = _sddtz.timezone('Asia/Bangkok')
-        _st = scanned_at.astimezone(_bkk) if hasattr(scanned_at, 'astimezone') else scanned_at
-        from datetime import time as _t
-        from datetime import timedelta as _tdd
-        # scan_data_date: midday break ยังถือว่า candle ของวันนั้นยังไม่ settle
-        _in_mkt = (
-            _st.weekday() < 5 and (
-                _t(10, 0) <= _st.time() <= _t(12, 30) or
-                _t(12, 30) < _st.time() < _t(14, 30) or
-                _t(14, 30) <= _st.time() <= _t(16, 30)
-            )
-        )
-        context['scan_data_date'] = (_st.date() - _tdd(days=1)) if _in_mkt else _st.date()
-
-    # Build AI scan JSON for Gemini analysis button
-    import json as _scan_json
-    def _ser_c(c):
-        return {
-            "symbol": c.symbol,
-            "price": c.price,
-            "buy_score": getattr(c, 'buy_score', 0),
-            "rs_rating": getattr(c, 'rs_rating', 0),
-            "rsi": round(c.rsi, 1),
-            "adx": round(c.adx, 1),
-            "rvol": round(c.rvol, 2),
-            "rvol_bullish": c.rvol_bullish,
-            "risk_reward_ratio": c.risk_reward_ratio,
-            "zone_proximity": round(c.zone_proximity, 1) if c.zone_proximity else None,
-            "macd_crossover": getattr(c, 'macd_crossover', False),
-            "ema20_aligned": getattr(c, 'ema20_aligned', False),
-            "ema20_rising": getattr(c, 'ema20_rising', False),
-            "hh_hl_structure": getattr(c, 'hh_hl_structure', False),
-            "bb_squeeze": getattr(c, 'bb_squeeze', False),
-            "rel_momentum_3m": getattr(c, 'rel_momentum_3m', 0),
-            "sector": c.sector,
-            "exit_signal": getattr(c, 'exit_signal', ''),
-            "top_reasons": getattr(c, 'top_reasons', []),
-        }
-    _ai_data = {
-        "scan_date": str(context.get('scan_data_date', '')),
-        "qualified_stocks": [_ser_c(c) for c in top5_qualified],
-        "top_buy_stocks": [_ser_c(c) for c in top5_buy],
-        "total_passed": len(candidates),
-        "top_sectors": [{"name": s["name"], "count": s["count"]} for s in top_sectors],
-    }
-    context['ai_scan_json'] = _scan_json.dumps(_ai_data, ensure_ascii=False, default=str).replace('</script>', '<\\/script>')
-
-    # Fetch latest Cup & Handle and Turtle breakout symbols for horizon classification
-    from stocks.models import CupHandleCandidate, TurtleScanCandidate, Portfolio as _PortfolioUS
-    from stocks.utils import simple_trailing_stop
-
-    # Latest Cup & Handle
-    latest_ch_run = CupHandleCandidate.objects.filter(user=request.user, market='US').values_list('scan_run', flat=True).order_by('-scan_run').first()
-    ch_symbols = set(CupHandleCandidate.objects.filter(user=request.user, market='US', scan_run=latest_ch_run).values_list('symbol', flat=True)) if latest_ch_run else set()
-    context['cup_handle_symbols'] = ch_symbols
-
-    # Latest Turtle Breakout
-    latest_turtle_run = TurtleScanCandidate.objects.filter(user=request.user, market='US').values_list('scan_run', flat=True).order_by('-scan_run').first()
-    turtle_symbols = set(TurtleScanCandidate.objects.filter(user=request.user, market='US', scan_run=latest_turtle_run).values_list('symbol', flat=True)) if latest_turtle_run else set()
-    context['turtle_symbols'] = turtle_symbols
-
-    # ── Pyramid Alert + Let Profit Run ───────────────────────────────────
-    # Pyramid: แสดง badge เมื่อหุ้นในพอร์ตขึ้น >=3%, Volume >=1.5x, ยังเหลือ upside >=5%, ไม่มี exit signal
-    # Let Profit Run: แสดง badge เมื่อหุ้นในพอร์ตล็อกกำไรบางส่วนไปแล้วและกำลังเทรลราคาส่วนที่เหลือ (tp1_hit=True)
-    _port_entry = {}
-    trailing_status = {}
-    for p in _PortfolioUS.objects.filter(user=request.user, market='US'):
-        ep = float(p.entry_price or 0)
-        if ep > 0:
-            _port_entry[p.symbol.split('.')[0].upper()] = ep
-        if p.tp1_hit:
-            trail_stop = simple_trailing_stop(p.highest_price, p.atr, p.trail_multiplier)
-            gain_pct = ((float(p.highest_price or 0) - ep) / ep * 100) if ep > 0 and p.highest_price else None
-            trailing_status[p.symbol.split('.')[0].upper()] = {
-                'trail_stop': trail_stop,
-                'tp1_price': p.tp1_price,
-                'gain_pct': gain_pct,
-            }
-    context['trailing_status'] = trailing_status
-
-    pyramid_ready = set()
-    for _c in candidates:
-        _entry = _port_entry.get(_c.symbol.split('.')[0].upper(), 0)
-        if _entry <= 0:
-            continue
-        _curr = float(getattr(_c, 'live_price', None) or _c.price or 0)
-        if _curr <= 0:
-            continue
-        _gain = (_curr - _entry) / _entry * 100
-        if (
-            _gain >= 3.0 and
-            getattr(_c, 'exit_signal', '') not in ('EXIT', 'STRONG EXIT') and
-            float(getattr(_c, 'volume_surge', 0) or 0) >= 1.5 and
-            float(getattr(_c, 'upside_to_tp', 0) or 0) >= 5
-        ):
-            pyramid_ready.add(_c.symbol)
-    context['pyramid_ready'] = pyramid_ready
-
-    return render(request, 'stocks/us_precision_scan.html', context)
+    return _precision_scanner_view(request, 'US')
 
 
 
@@ -6325,21 +2851,11 @@ def us_value_scanner(request):
                   .order_by(sort_map.get(current_sort, '-total_score')))
             candidates = list(qs)
 
-            # Live prices (fast_info)
+            # Live prices (batch ผ่าน quote_service)
             live_prices = {}
             try:
-                import concurrent.futures as _lcf
-                def _get_live_val(sym):
-                    try:
-                        fi = yf.Ticker(sym).fast_info
-                        p = getattr(fi, 'last_price', None)
-                        return sym, round(float(p), 2) if p else None
-                    except Exception:
-                        return sym, None
-                with _lcf.ThreadPoolExecutor(max_workers=12) as ex:
-                    for sym, p in ex.map(_get_live_val, [c.symbol for c in candidates]):
-                        if p:
-                            live_prices[sym] = p
+                from stocks.quote_service import get_live_prices
+                live_prices = {sym: round(p, 2) for sym, p in get_live_prices([c.symbol for c in candidates]).items()}
             except Exception:
                 pass
             for c in candidates:
@@ -6359,6 +2875,10 @@ def us_value_scanner(request):
     scan_time = _dt.now(_tz.utc)
     results = []
 
+    # แท่งราคา 1 ปีของทั้งชุดจากคลังกลาง (เติมเฉพาะหางที่ขาด) — ใช้คำนวณ indicator แทน yf.download รายตัว
+    from stocks.bar_store import get_bars
+    _bars = get_bars(symbols)
+
     def _process_value_symbol(sym):
         try:
             ticker = yf.Ticker(sym)
@@ -6381,12 +2901,10 @@ def us_value_scanner(request):
             if mkt_cap < 2:
                 return None
 
-            # Download 1-year price history for technical indicators
-            df = yf.download(sym, period='1y', progress=False, auto_adjust=True)
+            # 1-year price history for technical indicators
+            df = _bars.get(sym)
             if df is None or len(df) < 50:
                 return None
-            if isinstance(df.columns, pd.MultiIndex):
-                df.columns = df.columns.droplevel(1)
 
             val_score, qual_score, price_score, total = _score_value_candidate(info, df)
 
@@ -6453,679 +2971,125 @@ def us_value_scanner(request):
             if r:
                 results.append(r)
 
-    results.sort(key=lambda x: -x['total_score'])
-
-    # Fetch previous symbols for new-entry flag
-    prev_run_q = (ValueScanCandidate.objects
-                  .filter(user=request.user)
-                  .order_by('-scan_run')
-                  .values_list('scan_run', flat=True)
-                  .distinct()[:1])
-    prev_symbols = set()
-    if prev_run_q:
-        prev_symbols = set(
-            ValueScanCandidate.objects.filter(user=request.user, scan_run=prev_run_q[0])
-            .values_list('symbol', flat=True)
-        )
-
-    # Save new results FIRST
-    to_create = []
-    for r in results:
-        to_create.append(ValueScanCandidate(
-            user=request.user, scan_run=scan_time,
-            symbol=r['symbol'], name=r['name'], sector=r['sector'],
-            price=r['price'], market_cap=r['market_cap'],
-            pe_ratio=r['pe_ratio'], forward_pe=r['forward_pe'],
-            pb_ratio=r['pb_ratio'], peg_ratio=r['peg_ratio'],
-            ps_ratio=r['ps_ratio'], dividend_yield=r['dividend_yield'],
-            roe=r['roe'], profit_margin=r['profit_margin'],
-            debt_equity=r['debt_equity'], current_ratio=r['current_ratio'],
-            revenue_growth=r['revenue_growth'], fcf_yield=r['fcf_yield'],
-            rsi=r['rsi'], year_high=r['year_high'], year_low=r['year_low'],
-            pct_from_high=r['pct_from_high'], above_ema200=r['above_ema200'],
-            valuation_score=r['valuation_score'],
-            quality_score=r['quality_score'],
-            price_action_score=r['price_action_score'],
-            total_score=r['total_score'],
-            is_new_entry=(r['symbol'] not in prev_symbols),
-        ))
-    ValueScanCandidate.objects.bulk_create(to_create)
-
-    # THEN delete old runs (keep last 3)
-    distinct_runs = list(
-        ValueScanCandidate.objects
-        .filter(user=request.user)
-        .values_list('scan_run', flat=True)
-        .order_by('-scan_run').distinct()
-    )
-    if len(distinct_runs) > 3:
-        ValueScanCandidate.objects.filter(
-            user=request.user, scan_run__in=distinct_runs[3:]
-        ).delete()
-
-    return redirect(f'/stocks/value/us-value/?sort={current_sort}&run_idx=0')
-
-
-# ======================================================================
-# US SEPA SCANNER - แยกต่างหากจาก US Precision Scanner
-# Model: USSepaCandidate (ไม่แตะ PrecisionScanCandidate เลย)
-# ======================================================================
-
-# ============================================================
-# ฟังก์ชัน: us_sepa_scanner
-# วัตถุประสงค์: สแกนหุ้น US ตามระบบ Minervini SEPA
-#   เวอร์ชัน US ของ minervini_sepa_scanner
-#   ค้นหา Growth Stocks ที่อยู่ใน Stage 2 Uptrend
-#   และใกล้ Breakout จาก Consolidation Pattern
-# ============================================================
-@login_required
-def us_sepa_scanner(request):
-    """
-    US SEPA Scanner - Stage 2 + VCP + RS ≥70 สำหรับหุ้น Nasdaq/S&P500
-    ใช้ USSepaCandidate (แยกต่างหากจาก PrecisionScanCandidate อย่างสมบูรณ์)
-    """
-    import pandas as pd
-    import yfinance as yf
-
-    from stocks.models import ScannableSymbol, ScanWatchlistItem, USSepaCandidate
-
-    # AJAX scan status
-    if request.GET.get('scan_status') == '1':
-        from django.core.cache import cache as _cp
-        from django.http import JsonResponse as _JR
-        _key = f'us_sepa_scan_{request.user.id}'
-        st = _cp.get(_key, {'state': 'idle'})
-        if st.get('state') == 'done':
-            _cp.delete(_key)
-        return _JR(st)
-
-    # ── Trigger background scan ────────────────────────────────────
-    if request.method == 'POST' or request.GET.get('scan') == 'true':
-        import threading
-
-        from django.core.cache import cache as _cache_bg
-        user_id   = request.user.id
-        cache_key = f'us_sepa_scan_{user_id}'
-
-        if _cache_bg.get(cache_key, {}).get('state') == 'running':
-            return redirect('stocks:us_sepa_scanner')
-
-        sym_list = list(ScannableSymbol.objects.filter(is_active=True, market='US').values_list('symbol', flat=True))
-        if len(sym_list) < 100:
-            _seed_us_symbols()
-            sym_list = list(ScannableSymbol.objects.filter(is_active=True, market='US').values_list('symbol', flat=True))
-
-        _cache_bg.set(cache_key, {'state': 'running', 'progress': 0, 'total': len(sym_list), 'phase': 'Starting US SEPA scan…'}, timeout=1200)
-
-        def _run_bg(uid, ckey, syms):
-            try:
-                import django; django.setup()
-                import concurrent.futures
-                from datetime import datetime as _dt
-                from datetime import timedelta as _td
-
-                import pandas_ta as ta
-                import pytz as _pytz
-                from django.contrib.auth import get_user_model
-                from django.core.cache import cache as _c
-                from django.utils import timezone as tz
-
-                from stocks.models import ScannableSymbol
-                from stocks.models import USSepaCandidate as _USC
-                from stocks.utils import detect_vcp_pattern
-
-                User = get_user_model()
-                user = User.objects.get(pk=uid)
-                _ny  = _pytz.timezone('America/New_York')
-                now  = _dt.now(_ny)
-                end_str   = (now.date() + _td(days=1)).strftime('%Y-%m-%d')
-                start_str = (now.date() - _td(days=600)).strftime('%Y-%m-%d')
-                scan_run  = tz.now()
-
-                # Keep only 3 latest runs
-                old_runs = list(_USC.objects.filter(user=user).values_list('scan_run', flat=True).distinct().order_by('-scan_run')[3:])
-                if old_runs:
-                    _USC.objects.filter(user=user, scan_run__in=old_runs).delete()
-
-                # ── Step 1: Compute RS Rating ─────────────────────────────
-                _c.set(ckey, {'state': 'running', 'progress': 0, 'total': len(syms), 'phase': 'Computing RS Ratings…'}, timeout=1200)
-
-                import logging as _log
-                _sepa_log = _log.getLogger('stocks.us_sepa')
-
-                def _fetch_rs(s):
-                    try:
-                        d = yf.Ticker(s).history(start=start_str, end=end_str, interval='1d')
-                        if d is None or d.empty: return s, None
-                        if isinstance(d.columns, pd.MultiIndex): d.columns = d.columns.droplevel(1)
-                        cl = d['Close'].dropna()
-                        if len(cl) < 252: return s, None
-                        r = float(
-                            (cl.iloc[-1]-cl.iloc[-64])/abs(cl.iloc[-64])*0.4 +
-                            (cl.iloc[-64]-cl.iloc[-127])/abs(cl.iloc[-127])*0.2 +
-                            (cl.iloc[-127]-cl.iloc[-190])/abs(cl.iloc[-190])*0.2 +
-                            (cl.iloc[-190]-cl.iloc[-253])/abs(cl.iloc[-253])*0.2
-                        ) * 100
-                        return s, r
-                    except Exception as _e:
-                        _sepa_log.debug(f'[US SEPA] RS fetch {s}: {_e}')
-                        return s, None
-
-                rs_raw = {}
-                with concurrent.futures.ThreadPoolExecutor(max_workers=5) as ex:
-                    for s, r in ex.map(_fetch_rs, syms):
-                        if r is not None: rs_raw[s] = r
-                rs_map = {}
-                if rs_raw:
-                    ser = pd.Series(rs_raw)
-                    rs_map = (ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                # ── Step 2: SEPA Technical Scan ───────────────────────────
-                _c.set(ckey, {'state': 'running', 'progress': 0, 'total': len(syms), 'phase': 'SEPA Technical Scan…'}, timeout=1200)
-
-                results = []
-                def _scan_one(symbol):
-                    try:
-                        rs_v = rs_map.get(symbol, 0)
-                        if rs_v < 60: return None  # pre-filter; display shows ≥70
-
-                        df = yf.Ticker(symbol).history(start=start_str, end=end_str, interval='1d')
-                        if df is None or df.empty: return None
-                        if isinstance(df.columns, pd.MultiIndex): df.columns = df.columns.droplevel(1)
-                        df = df.dropna(subset=['Close', 'High', 'Low'])
-                        if len(df) < 200: return None
-
-                        # Liquidity: avg daily volume ≥ 500K shares
-                        if float(df['Volume'].tail(20).mean()) < 500_000: return None
-
-                        curr = float(df['Close'].iloc[-1])
-                        year_h = float(df['High'].tail(252).max())
-
-                        # Stage 2: price > SMA150 AND SMA150 trending up
-                        s2 = False
-                        try:
-                            s150 = ta.sma(df['Close'], 150)
-                            if s150 is not None and pd.notna(s150.iloc[-1]) and pd.notna(s150.iloc[-20]):
-                                s2 = (curr > float(s150.iloc[-1])) and (float(s150.iloc[-1]) > float(s150.iloc[-20]))
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] SMA150 {symbol}: {_e}')
-                        if not s2: return None
-
-                        # ADX
-                        adx_v = 0.0
-                        try:
-                            adx_df = ta.adx(df['High'], df['Low'], df['Close'], 14)
-                            if adx_df is not None:
-                                col = [c for c in adx_df.columns if c.startswith('ADX_')]
-                                if col and pd.notna(adx_df[col[0]].iloc[-1]):
-                                    adx_v = float(adx_df[col[0]].iloc[-1])
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] ADX {symbol}: {_e}')
-
-                        # RSI
-                        rsi_v = 50.0
-                        try:
-                            r = ta.rsi(df['Close'], 14)
-                            if r is not None and pd.notna(r.iloc[-1]):
-                                rsi_v = float(r.iloc[-1])
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] RSI {symbol}: {_e}')
-
-                        # RVOL
-                        rvol_v = 1.0
-                        try:
-                            avg20 = float(df['Volume'].tail(20).mean())
-                            if avg20 > 0:
-                                rvol_v = round(float(df['Volume'].iloc[-1]) / avg20, 2)
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] RVOL {symbol}: {_e}')
-
-                        # VCP
-                        vcp = detect_vcp_pattern(df)
-
-                        # VDU (Volume Dry-Up near zone)
-                        vdu_near = False
-                        try:
-                            rv5 = float(df['Volume'].tail(5).mean())
-                            rv50 = float(df['Volume'].tail(50).mean())
-                            vdu_near = (rv5 < rv50 * 0.70) and (curr >= year_h * 0.88)
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] VDU {symbol}: {_e}')
-
-                        # Pocket Pivot
-                        pp = False
-                        try:
-                            vols = df['Volume'].values
-                            closes = df['Close'].values
-                            if len(vols) >= 12:
-                                today_vol = vols[-1]
-                                today_up  = closes[-1] > closes[-2]
-                                dn_vols   = [vols[-(i+2)] for i in range(10) if closes[-(i+2)] < closes[-(i+3)]]
-                                if today_up and dn_vols and today_vol > max(dn_vols):
-                                    pp = True
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] PocketPivot {symbol}: {_e}')
-
-                        # ── Minervini Earnings Criteria ────────────────────
-                        eps_g = 0.0
-                        rev_g = 0.0
-                        roe_v = 0.0
-                        eps_accel = False
-                        earnings_pass = False
-                        try:
-                            _info = yf.Ticker(symbol).info
-                            eps_g = float(_info.get('earningsQuarterlyGrowth', 0) or 0) * 100
-                            rev_g = float(_info.get('revenueGrowth', 0) or 0) * 100
-                            roe_v = float(_info.get('returnOnEquity', 0) or 0) * 100
-                            # EPS Acceleration: check trailing EPS vs forward EPS estimate
-                            eps_trailing = float(_info.get('trailingEps', 0) or 0)
-                            eps_forward  = float(_info.get('forwardEps', 0) or 0)
-                            if eps_trailing > 0 and eps_forward > eps_trailing:
-                                eps_accel = True
-                            earnings_pass = (eps_g >= 25) or (rev_g >= 25)
-                        except Exception as _e:
-                            _sepa_log.debug(f'[US SEPA] Earnings {symbol}: {_e}')
-
-                        return {
-                            'symbol': symbol,
-                            'price': round(curr, 2),
-                            'stage2': True,
-                            'rs_rating': rs_v,
-                            'vcp_setup': vcp.get('setup', False),
-                            'vcp_contractions': vcp.get('contractions', 0),
-                            'vcp_tightness': vcp.get('tightness', 0.0),
-                            'vcp_vdu': vcp.get('vdu_confirmed', False),
-                            'pocket_pivot': pp,
-                            'vdu_near_zone': vdu_near,
-                            'adx': round(adx_v, 1),
-                            'rsi': round(rsi_v, 1),
-                            'rvol': rvol_v,
-                            'year_high': round(year_h, 2),
-                            'upside_to_high': round((year_h - curr) / curr * 100, 2),
-                            'eps_growth': round(eps_g, 1),
-                            'rev_growth': round(rev_g, 1),
-                            'roe': round(roe_v, 1),
-                            'eps_accel': eps_accel,
-                            'earnings_pass': earnings_pass,
-                        }
-                    except Exception as _e:
-                        _sepa_log.debug(f'[US SEPA] scan {symbol}: {_e}')
-                        return None
-
-                done = 0
-                with concurrent.futures.ThreadPoolExecutor(max_workers=5) as ex:
-                    futs = {ex.submit(_scan_one, s): s for s in syms}
-                    for fut in concurrent.futures.as_completed(futs):
-                        done += 1
-                        if done % 15 == 0:
-                            _c.set(ckey, {'state': 'running', 'progress': done, 'total': len(syms), 'phase': f'Scanning {done}/{len(syms)}…'}, timeout=1200)
-                        r = fut.result()
-                        if r: results.append(r)
-
-                # ── Step 3: Enrich sector names ───────────────────────────
-                if results:
-                    _c.set(ckey, {'state': 'running', 'progress': done, 'total': len(syms), 'phase': 'Fetching sector data…'}, timeout=1200)
-                    from yahooquery import Ticker as YQT
-                    sector_map = {}
-                    name_map   = {}
-                    try:
-                        yqa = YQT([r['symbol'] for r in results])
-                        mods = yqa.get_modules('summaryProfile quoteType')
-                        for k, d in mods.items():
-                            if isinstance(d, dict):
-                                sp = d.get('summaryProfile', {})
-                                qt = d.get('quoteType', {})
-                                sector_map[k.upper()] = sp.get('sector', 'Unknown') or 'Unknown'
-                                name_map[k.upper()]   = qt.get('shortName', '') or ''
-                    except Exception as _e:
-                        _sepa_log.warning(f'[US SEPA] sector fetch error: {_e}')
-
-                    bulk = [_USC(
-                        user=user, scan_run=scan_run,
-                        symbol=r['symbol'],
-                        name=name_map.get(r['symbol'], ''),
-                        sector=sector_map.get(r['symbol'], 'Unknown'),
-                        price=r['price'],
-                        stage2=r['stage2'],
-                        rs_rating=r['rs_rating'],
-                        vcp_setup=r['vcp_setup'],
-                        vcp_contractions=r['vcp_contractions'],
-                        vcp_tightness=r['vcp_tightness'],
-                        vcp_vdu=r['vcp_vdu'],
-                        pocket_pivot=r['pocket_pivot'],
-                        vdu_near_zone=r['vdu_near_zone'],
-                        adx=r['adx'],
-                        rsi=r['rsi'],
-                        rvol=r['rvol'],
-                        year_high=r['year_high'],
-                        upside_to_high=r['upside_to_high'],
-                        eps_growth=r.get('eps_growth', 0.0),
-                        rev_growth=r.get('rev_growth', 0.0),
-                        roe=r.get('roe', 0.0),
-                        eps_accel=r.get('eps_accel', False),
-                        earnings_pass=r.get('earnings_pass', False),
-                    ) for r in results]
-                    _USC.objects.bulk_create(bulk)
-
-                _c.set(ckey, {'state': 'done'}, timeout=300)
-            except Exception as exc:
-                import logging
-                logging.getLogger('stocks').exception(f'[US SEPA] bg scan error: {exc}')
-                from django.core.cache import cache as _c2
-                _c2.set(ckey, {'state': 'done'}, timeout=300)
-
-        import threading as _thr
-        _thr.Thread(target=_run_bg, args=(request.user.id, cache_key, sym_list), daemon=True).start()
-        return redirect('stocks:us_sepa_scanner')
-
-    # ── Display ────────────────────────────────────────────────────
-    all_runs = list(
-        USSepaCandidate.objects.filter(user=request.user)
-        .values_list('scan_run', flat=True).distinct().order_by('-scan_run')
-    )
-    try:
-        run_idx = max(0, min(int(request.GET.get('run_idx', 0)), len(all_runs) - 1)) if all_runs else 0
-    except (ValueError, TypeError):
-        run_idx = 0
-
-    candidates  = []
-    last_updated = None
-    if all_runs:
-        run_time    = all_runs[run_idx]
-        candidates  = list(USSepaCandidate.objects.filter(user=request.user, scan_run=run_time).order_by('-vcp_setup', '-rs_rating'))
-        last_updated = run_time
-
-    # Filters
-    vcp_only        = request.GET.get('vcp_only') == '1'
-    hide_at_tp      = request.GET.get('hide_at_tp', '1') == '1'
-    earnings_filter = request.GET.get('earnings_filter') == '1'
-
-    if vcp_only:
-        candidates = [c for c in candidates if c.vcp_setup]
-    if hide_at_tp:
-        candidates = [c for c in candidates if c.upside_to_high >= 10.0]
-
-    # RS filter: enforce ≥70 (scan saves down to 60 for flexibility)
-    candidates = [c for c in candidates if c.rs_rating >= 70]
-
-    # Earnings filter: EPS Growth ≥ 25% หรือ Revenue Growth ≥ 25% (Minervini criteria)
-    if earnings_filter:
-        candidates = [c for c in candidates if getattr(c, 'earnings_pass', False) or getattr(c, 'eps_growth', 0) >= 25 or getattr(c, 'rev_growth', 0) >= 25]
-
-    # Computed display fields + SEPA Score
-    for c in candidates:
-        c.dist_from_pivot = round(c.upside_to_high, 1)
-        if c.upside_to_high < 5:
-            c.tp_status = 'at_tp'
-        elif c.upside_to_high < 10:
-            c.tp_status = 'near_tp'
-        else:
-            c.tp_status = None
-
-        # Earnings badge helper attrs
-        eps_g = getattr(c, 'eps_growth', 0.0) or 0.0
-        rev_g = getattr(c, 'rev_growth', 0.0) or 0.0
-        roe_v = getattr(c, 'roe', 0.0) or 0.0
-        c.eps_badge = 'strong' if eps_g >= 50 else ('pass' if eps_g >= 25 else ('warn' if eps_g >= 0 else 'fail'))
-        c.rev_badge = 'strong' if rev_g >= 50 else ('pass' if rev_g >= 25 else ('warn' if rev_g >= 0 else 'fail'))
-        c.roe_badge = 'pass' if roe_v >= 17 else 'warn'
-
-        # ── SEPA Score (0-220 incl. earnings bonus) ────────────
-        sc = 0
-        if c.vcp_setup:
-            sc += 30
-            sc += int(max(0, (10 - min(c.vcp_tightness, 10)) * 2))
-            sc += min(c.vcp_contractions, 5) * 3
-        if c.vcp_vdu or c.vdu_near_zone:
-            sc += 20
-        if c.pocket_pivot:
-            sc += 10
-        sc += int(c.rs_rating * 0.7)
-        if c.adx >= 25:
-            sc += 10
-        elif c.adx >= 15:
-            sc += 5
-        if c.vcp_setup:
-            dist = c.dist_from_pivot
-            if dist <= 5:
-                sc += 10
-            elif dist <= 10:
-                sc += 5
-            elif dist > 15:
-                sc -= 5
-        # ── Earnings bonus (Minervini) ──────────────────────────
-        if eps_g >= 50:  sc += 20
-        elif eps_g >= 25: sc += 12
-        elif eps_g >= 10: sc += 5
-        if rev_g >= 50:  sc += 10
-        elif rev_g >= 25: sc += 6
-        if roe_v >= 17:   sc += 8
-        elif roe_v >= 10: sc += 3
-        if getattr(c, 'eps_accel', False): sc += 10
-        c.sepa_score = sc
+    results.sort(key=lambda x: -x['total_score'])
 
-    # Sort by SEPA Score descending
-    candidates.sort(key=lambda c: c.sepa_score, reverse=True)
+    # Fetch previous symbols for new-entry flag
+    prev_run_q = (ValueScanCandidate.objects
+                  .filter(user=request.user)
+                  .order_by('-scan_run')
+                  .values_list('scan_run', flat=True)
+                  .distinct()[:1])
+    prev_symbols = set()
+    if prev_run_q:
+        prev_symbols = set(
+            ValueScanCandidate.objects.filter(user=request.user, scan_run=prev_run_q[0])
+            .values_list('symbol', flat=True)
+        )
 
-    # Assign rank
-    for i, c in enumerate(candidates, 1):
-        c.sepa_rank = i
+    # Save new results FIRST
+    to_create = []
+    for r in results:
+        to_create.append(ValueScanCandidate(
+            user=request.user, scan_run=scan_time,
+            symbol=r['symbol'], name=r['name'], sector=r['sector'],
+            price=r['price'], market_cap=r['market_cap'],
+            pe_ratio=r['pe_ratio'], forward_pe=r['forward_pe'],
+            pb_ratio=r['pb_ratio'], peg_ratio=r['peg_ratio'],
+            ps_ratio=r['ps_ratio'], dividend_yield=r['dividend_yield'],
+            roe=r['roe'], profit_margin=r['profit_margin'],
+            debt_equity=r['debt_equity'], current_ratio=r['current_ratio'],
+            revenue_growth=r['revenue_growth'], fcf_yield=r['fcf_yield'],
+            rsi=r['rsi'], year_high=r['year_high'], year_low=r['year_low'],
+            pct_from_high=r['pct_from_high'], above_ema200=r['above_ema200'],
+            valuation_score=r['valuation_score'],
+            quality_score=r['quality_score'],
+            price_action_score=r['price_action_score'],
+            total_score=r['total_score'],
+            is_new_entry=(r['symbol'] not in prev_symbols),
+        ))
+    ValueScanCandidate.objects.bulk_create(to_create)
+
+    # THEN delete old runs (keep last 3)
+    distinct_runs = list(
+        ValueScanCandidate.objects
+        .filter(user=request.user)
+        .values_list('scan_run', flat=True)
+        .order_by('-scan_run').distinct()
+    )
+    if len(distinct_runs) > 3:
+        ValueScanCandidate.objects.filter(
+            user=request.user, scan_run__in=distinct_runs[3:]
+        ).delete()
 
-    watchlist_symbols = set(ScanWatchlistItem.objects.filter(user=request.user).values_list('symbol', flat=True))
+    return redirect(f'/stocks/value/us-value/?sort={current_sort}&run_idx=0')
 
-    context = {
-        'candidates':       candidates,
-        'last_updated':     last_updated,
-        'all_runs':         all_runs,
-        'selected_run_idx': run_idx,
-        'vcp_only':         vcp_only,
-        'hide_at_tp':       hide_at_tp,
-        'earnings_filter':  earnings_filter,
-        'watchlist_symbols': watchlist_symbols,
-    }
-    return render(request, 'stocks/us_sepa_scanner.html', context)
 
+# ======================================================================
+# US SEPA SCANNER - แยกต่างหากจาก US Precision Scanner
+# Model: USSepaCandidate (ไม่แตะ PrecisionScanCandidate เลย)
+# ======================================================================
 
 # ============================================================
-# ฟังก์ชัน: cup_handle_scanner
-# วัตถุประสงค์: สแกนหารูปแบบ Cup & Handle ในหุ้น SET
-#   รูปแบบนี้พัฒนาโดย William O'Neil เป็นสัญญาณ Breakout
-#   ตรวจจับ: Cup Depth, Handle Formation, Volume Pattern
-#   และ Pivot Point เพื่อหาจุดเข้าซื้อ
+# ฟังก์ชัน: us_sepa_scanner
+# วัตถุประสงค์: สแกนหุ้น US ตามระบบ Minervini SEPA
+#   เวอร์ชัน US ของ minervini_sepa_scanner
+#   ค้นหา Growth Stocks ที่อยู่ใน Stage 2 Uptrend
+#   และใกล้ Breakout จาก Consolidation Pattern
 # ============================================================
 @login_required
-def cup_handle_scanner(request):
-    import threading as _th
+def us_sepa_scanner(request):
+    """
+    US SEPA Scanner - Stage 2 + VCP + RS ≥70 สำหรับหุ้น Nasdaq/S&P500
+    ใช้ USSepaCandidate (แยกต่างหากจาก PrecisionScanCandidate อย่างสมบูรณ์)
+    """
+    return _sepa_scanner_view(request, 'US')
 
-    from django.core.cache import cache as _cp
-    from django.http import JsonResponse as _JR
 
-    user_id   = request.user.id
-    cache_key = f'cup_handle_scan_{user_id}'
+# ============================================================
+# Cup & Handle Scanner (SET / US) — สแกนผ่าน stocks.cup_handle_scan, หน้าแสดงผลใช้ร่วมกันใน _cup_handle_scanner_view
+# ============================================================
+# หน้า/ชื่อของ Cup & Handle Scanner แต่ละตลาด — เกณฑ์การสแกนอยู่ใน stocks.cup_handle_scan.RULES
+_CUP_HANDLE_PAGES = {
+    'SET': {'template': 'stocks/cup_handle_scan.html', 'url_name': 'stocks:cup_handle_scanner',
+            'job': 'cup_handle_scan'},
+    'US': {'template': 'stocks/us_cup_handle_scan.html', 'url_name': 'stocks:us_cup_handle_scanner',
+           'job': 'us_cup_handle_scan'},
+}
+
+_CUP_HANDLE_STAGES = {
+    'breakout': ('Breakout',       '#16a34a'),
+    'ready':    ('Ready to Break', '#2563eb'),
+    'handle':   ('Handle Forming', '#d97706'),
+    'forming':  ('Cup Forming',    '#64748b'),
+}
+
+
+def _cup_handle_scanner_view(request, market_code):
+    """
+    เนื้อหาร่วมของ cup_handle_scanner (SET) และ us_cup_handle_scanner (US)
+    POST หรือ ?scan=true → รัน stocks.cup_handle_scan.run_cup_handle_scan ใน background thread
+    GET → แสดงผลรอบสแกนที่เลือก (?run_idx=) เรียง Stage → Confidence พร้อมตัวกรอง stage / confidence / RS
+    """
+    from stocks.cup_handle_scan import run_cup_handle_scan
+    from stocks.models import CupHandleCandidate as _CHC
+    from stocks.models import ScannableSymbol as _SS
+    from stocks.models import ScanWatchlistItem as _SWI
+    from stocks.scan_pipeline import MARKETS
+
+    market = MARKETS[market_code]
+    page = _CUP_HANDLE_PAGES[market_code]
+    cache_key = f"{page['job']}_{request.user.id}"
 
     if request.GET.get('scan_status') == '1':
-        st = _cp.get(cache_key, {'state': 'idle'})
-        if st.get('state') == 'done':
-            _cp.delete(cache_key)
-        return _JR(st)
+        return _scan_status_response(cache_key)
 
     if request.GET.get('scan') == 'true' or request.method == 'POST':
-
-        from stocks.utils import refresh_all_thai_symbols, get_top_ranked_symbols
-        scan_symbols = get_top_ranked_symbols(market='SET', limit=300, auto_refresh=True)
-
-        from stocks.utils import get_top_ranked_symbols, refresh_all_thai_symbols
-        scan_symbols = get_top_ranked_symbols(market='SET', limit=400, auto_refresh=True)
-
-
-        if not scan_symbols:
-            refresh_all_thai_symbols()
-            scan_symbols = get_top_ranked_symbols(market='SET', limit=300, auto_refresh=True)
-
-        already = _cp.get(cache_key, {})
-        if already.get('state') != 'running':
-            _cp.set(cache_key, {'state': 'running', 'progress': 0, 'total': len(scan_symbols), 'phase': 'เริ่มสแกน Cup & Handle...'}, timeout=900)
-
-            def _run_cup_handle_bg(uid, ckey, sym_list):
-                try:
-                    import concurrent.futures as _cf
-                    import logging as _log
-                    from datetime import datetime as _dt
-                    from datetime import timedelta as _td
-
-                    import pandas as _pd
-                    import pandas_ta as _ta
-                    import pytz as _pytz
-                    import yfinance as _yf
-                    from django.contrib.auth import get_user_model
-                    from django.core.cache import cache as _c
-                    from django.utils import timezone as tz
-                    from yahooquery import Ticker as _TQ
-
-                    from stocks.models import CupHandleCandidate as _CHC
-                    from stocks.utils import detect_cup_and_handle
-                    from stocks.utils import get_top_ranked_symbols as _GTRS
-                    _ch_log = _log.getLogger('stocks.cup_handle')
-                    sym_list = _GTRS(market='SET', limit=300, auto_refresh=True)
-
-                    User      = get_user_model()
-                    user      = User.objects.get(pk=uid)
-                    _bkk      = _pytz.timezone('Asia/Bangkok')
-                    _now      = _dt.now(_bkk)
-                    _end_str  = (_now.date() + _td(days=1)).strftime('%Y-%m-%d')
-                    _start    = (_now.date() - _td(days=600)).strftime('%Y-%m-%d')
-                    _scan_run = tz.now()
-
-                    # 1. ลบข้อมูลเก่าที่เกิน 3 รอบ
-                    old_runs = list(_CHC.objects.filter(user=user).values_list('scan_run', flat=True).distinct().order_by('-scan_run'))
-                    if len(old_runs) >= 3:
-                        _CHC.objects.filter(user=user, scan_run__in=old_runs[2:]).delete()
-
-                    _CHC.objects.filter(user=user, scan_run=_scan_run).delete()
-
-                    total = len(sym_list)
-                    results = []
-
-                    # --- STAGE 1: Bulk Screening (Fast) ---
-                    _c.set(ckey, {'state': 'running', 'progress': 5, 'total': total, 'phase': 'Stage 1: 🔎 กรองสุขภาพคล่อง (Bulk)...'}, timeout=900)
-                    chunk_size = 100
-                    candidates = []
-                    for i in range(0, total, chunk_size):
-                        chunk = sym_list[i : i + chunk_size]
-                        chunk_bk = [f"{s}.BK" for s in chunk]
-                        try:
-                            tq = _TQ(chunk_bk, timeout=60)
-                            # summary_detail has 'averageVolume' (3-month) which is more stable for screening
-                            details = tq.summary_detail
-                            for symbol in chunk:
-                                s_bk = f"{symbol}.BK"
-                                if isinstance(details, dict) and s_bk in details:
-                                    d_data = details[s_bk]
-                                    if isinstance(d_data, dict):
-                                        vol_avg = d_data.get('averageVolume', 0) or 0
-                                        price   = d_data.get('previousClose', 0) or 0
-                                        # Liquidity filter: Value > 1,000,000 THB/day
-                                        if (vol_avg * price) >= 1_000_000:
-                                            candidates.append(symbol)
-                        except Exception as _e:
-                            _ch_log.warning(f'[Cup&Handle SET] bulk screen chunk failed: {_e}, adding chunk as fallback')
-                            candidates.extend(chunk)
-
-                    # --- STAGE 2: Pattern Analysis (Threaded) ---
-                    total_cand = len(candidates)
-                    _c.set(ckey, {'state': 'running', 'progress': 20, 'total': total_cand, 'phase': f'Stage 2: ☕ วิเคราะห์รูปแบบ {total_cand} ตัว...'}, timeout=900)
-
-                    def _scan_one(symbol):
-                        try:
-                            s_bk = f'{symbol}.BK'
-                            ticker_obj = _yf.Ticker(s_bk)
-                            df = ticker_obj.history(start=_start, end=_end_str, interval="1d")
-                            if df is None or df.empty or len(df) < 80:
-                                return None
-                            if isinstance(df.columns, _pd.MultiIndex):
-                                df.columns = df.columns.droplevel(1)
-                            df = df.dropna(subset=['Close', 'High', 'Low'])
-                            
-                            pat = detect_cup_and_handle(df)
-                            if pat is None: return None
-
-                            # RS return (3M)
-                            close_s = df['Close'].dropna()
-                            rs_return = None
-                            if len(close_s) >= 66:
-                                rs_return = float((close_s.iloc[-1] - close_s.iloc[-66]) / abs(close_s.iloc[-66]) * 100)
-
-                            # ADX & RSI
-                            adx_val, rsi_val = 0.0, 50.0
-                            try:
-                                adx_df = _ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                                if adx_df is not None and not adx_df.empty:
-                                    col = [c for c in adx_df.columns if c.startswith('ADX_')]
-                                    if col: adx_val = float(adx_df[col[0]].iloc[-1])
-                                rsi_s = _ta.rsi(df['Close'], length=14)
-                                if rsi_s is not None: rsi_val = float(rsi_s.iloc[-1])
-                            except Exception as _e:
-                                _ch_log.debug(f'[Cup&Handle SET] ADX/RSI {symbol}: {_e}')
-
-                            return {'symbol': symbol, 'pat': pat, 'rs_return': rs_return,
-                                    'adx': adx_val, 'rsi': rsi_val, 'avg_vol': float(df['Volume'].tail(20).mean())}
-                        except Exception as _e:
-                            _ch_log.debug(f'[Cup&Handle SET] scan {symbol}: {_e}')
-                            return None
-
-                    with _cf.ThreadPoolExecutor(max_workers=5) as ex:
-                        futs = {ex.submit(_scan_one, s): s for s in candidates}
-                        done = 0
-                        for fut in _cf.as_completed(futs):
-                            done += 1
-                            if done % 5 == 0:
-                                _c.set(ckey, {'state': 'running', 'progress': 20 + int((done/total_cand)*75), 'total': total_cand,
-                                              'phase': f'วิเคราะห์ {done}/{total_cand}...'}, timeout=900)
-                            try:
-                                res = fut.result()
-                                if res: results.append(res)
-                            except Exception as _e:
-                                _ch_log.debug(f'[Cup&Handle SET] future error {futs[fut]}: {_e}')
-                    
-                    # RS Percentile
-                    rs_map = {}
-                    rs_vals = {r['symbol']: r['rs_return'] for r in results if r['rs_return'] is not None}
-                    if rs_vals:
-                        rs_ser = _pd.Series(rs_vals)
-                        rs_map = (rs_ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                    # Save to DB
-                    objs = []
-                    for r in results:
-                        pat = dict(r['pat'])
-                        price_val = pat.pop('current_price', 0.0)
-                        objs.append(_CHC(
-                            user=user, scan_run=_scan_run, symbol=r['symbol'],
-                            price=price_val,
-                            market='SET',
-                            rs_rating=rs_map.get(r['symbol'], 0),
-                            adx=r['adx'], rsi=r['rsi'], avg_vol_20d=r['avg_vol'],
-                            **pat
-                        ))
-                    _CHC.objects.bulk_create(objs)
-                    _c.set(ckey, {'state': 'done', 'progress': 100}, timeout=300)
-                except Exception as exc:
-                    import logging
-                    logging.getLogger('stocks').exception(f'[Cup&Handle] bg scan error: {exc}')
-                    from django.core.cache import cache as _c2
-                    _c2.set(ckey, {'state': 'done'}, timeout=300)
-
-            _th.Thread(target=_run_cup_handle_bg, args=(user_id, cache_key, scan_symbols), daemon=True).start()
-
-        from django.shortcuts import redirect as _redir
-        return _redir('stocks:cup_handle_scanner')
+        _start_scan_thread(cache_key, request.user.id, run_cup_handle_scan, market.code, 'เริ่มสแกน Cup & Handle...')
+        return redirect(page['url_name'])
 
     # ── Display results ───────────────────────────────────────────
-    from stocks.models import CupHandleCandidate as _CHC
-    from stocks.models import ScanWatchlistItem as _SWI
-
     all_runs = list(
-        _CHC.objects.filter(user=request.user, market='SET')
+        _CHC.objects.filter(user=request.user, market=market.code)
         .values_list('scan_run', flat=True)
         .distinct().order_by('-scan_run')
     )
@@ -7140,20 +3104,15 @@ def cup_handle_scanner(request):
     scanned_at = None
     if all_runs:
         selected_run = all_runs[run_idx]
-        candidates   = list(_CHC.objects.filter(user=request.user, scan_run=selected_run, market='SET'))
+        candidates   = list(_CHC.objects.filter(user=request.user, market=market.code, scan_run=selected_run))
         scanned_at   = selected_run
 
     # เรียงตาม Stage Priority → Confidence เสมอ
-    stage_order = {'breakout': 0, 'ready': 1, 'handle': 2, 'forming': 3}
+    stage_order = {stage: i for i, stage in enumerate(_CUP_HANDLE_STAGES)}
     candidates.sort(key=lambda c: (stage_order.get(c.stage, 9), -c.confidence_score))
 
     # Stage counts (ก่อน filter เพื่อแสดงใน summary cards)
-    stage_counts = {
-        'breakout': sum(1 for c in candidates if c.stage == 'breakout'),
-        'ready':    sum(1 for c in candidates if c.stage == 'ready'),
-        'handle':   sum(1 for c in candidates if c.stage == 'handle'),
-        'forming':  sum(1 for c in candidates if c.stage == 'forming'),
-    }
+    stage_counts = {stage: sum(1 for c in candidates if c.stage == stage) for stage in _CUP_HANDLE_STAGES}
 
     # ── Filters ───────────────────────────────────────────────────
     stage_filter = request.GET.get('stage', 'all')
@@ -7174,8 +3133,7 @@ def cup_handle_scanner(request):
     for c in candidates:
         # % ห่างจาก Breakout Price
         if c.breakout_price > 0 and c.price > 0:
-            c.pct_to_breakout = round((c.breakout_price - c.price) / c.price * 100, 1)
-            c.pct_to_breakout = max(0.0, c.pct_to_breakout)
+            c.pct_to_breakout = max(0.0, round((c.breakout_price - c.price) / c.price * 100, 1))
         else:
             c.pct_to_breakout = 0.0
         # Recovery % (ใช้แสดง progress bar สำหรับ Forming)
@@ -7189,32 +3147,37 @@ def cup_handle_scanner(request):
     forming_list = [c for c in candidates if c.stage == 'forming']
     closest_forming = max(forming_list, key=lambda c: c.recovery_pct, default=None)
 
-    # Watchlist symbols ของ user
-    watchlist_symbols = set(
-        _SWI.objects.filter(user=request.user, market='SET').values_list('symbol', flat=True)
-    )
-
     context = {
-        'candidates':       candidates,
-        'has_scanned':      bool(all_runs),
-        'scanned_at':       scanned_at,
-        'all_runs':         all_runs,
-        'selected_run_idx': run_idx,
-        'current_sort':     request.GET.get('sort', 'stage'),
-        'stage_counts':     stage_counts,
-        'stage_filter':     stage_filter,
-        'min_conf':         min_conf,
-        'rs_only':          rs_only,
-        'closest_forming':  closest_forming,
-        'watchlist_symbols': watchlist_symbols,
-        'stage_labels': {
-            'breakout': ('Breakout',       '#16a34a'),
-            'ready':    ('Ready to Break', '#2563eb'),
-            'handle':   ('Handle Forming', '#d97706'),
-            'forming':  ('Cup Forming',    '#64748b'),
-        },
+        'candidates':        candidates,
+        'has_scanned':       bool(all_runs),
+        'scanned_at':        scanned_at,
+        'all_runs':          all_runs,
+        'selected_run_idx':  run_idx,
+        'current_sort':      request.GET.get('sort', 'stage'),
+        'stage_counts':      stage_counts,
+        'stage_filter':      stage_filter,
+        'min_conf':          min_conf,
+        'rs_only':           rs_only,
+        'closest_forming':   closest_forming,
+        'watchlist_symbols': set(
+            _SWI.objects.filter(user=request.user, market=market.code).values_list('symbol', flat=True)
+        ),
+        'stage_labels':      _CUP_HANDLE_STAGES,
+        'total_symbols':     _SS.objects.filter(is_active=True, market=market.code).count(),
     }
-    return render(request, 'stocks/cup_handle_scan.html', context)
+    return render(request, page['template'], context)
+
+
+# ============================================================
+# ฟังก์ชัน: cup_handle_scanner
+# วัตถุประสงค์: สแกนหารูปแบบ Cup & Handle ในหุ้น SET
+#   รูปแบบนี้พัฒนาโดย William O'Neil เป็นสัญญาณ Breakout
+#   ตรวจจับ: Cup Depth, Handle Formation, Volume Pattern
+#   และ Pivot Point เพื่อหาจุดเข้าซื้อ
+# ============================================================
+@login_required
+def cup_handle_scanner(request):
+    return _cup_handle_scanner_view(request, 'SET')
 
 
 # ====== US Cup & Handle Scanner ======
@@ -7235,284 +3198,7 @@ def us_cup_handle_scanner(request):
     - บันทึก market='US' แยกต่างหาก
     - ตรวจ breakout_vol_ok (volume ≥1.5x avg on breakout bar) - O'Neil rule
     """
-    import threading as _th
-
-    from django.core.cache import cache as _cp
-    from django.http import JsonResponse as _JR
-
-    user_id   = request.user.id
-    cache_key = f'us_cup_handle_scan_{user_id}'
-
-    if request.GET.get('scan_status') == '1':
-        st = _cp.get(cache_key, {'state': 'idle'})
-        if st.get('state') == 'done':
-            _cp.delete(cache_key)
-        return _JR(st)
-
-    if request.GET.get('scan') == 'true' or request.method == 'POST':
-        from stocks.models import ScannableSymbol as _SS
-        scan_symbols = list(_SS.objects.filter(is_active=True, market='US').values_list('symbol', flat=True))
-        if len(scan_symbols) < 100:
-            _seed_us_symbols()
-            scan_symbols = list(_SS.objects.filter(is_active=True, market='US').values_list('symbol', flat=True))
-        scan_symbols = [s for s in scan_symbols if s not in ('SPY', 'QQQ', 'IWM')]
-
-        already = _cp.get(cache_key, {})
-        if already.get('state') != 'running':
-            _cp.set(cache_key, {
-                'state': 'running', 'progress': 0,
-                'total': len(scan_symbols), 'phase': 'เริ่มสแกน US Cup & Handle...'
-            }, timeout=900)
-
-            def _run_us_cup_handle_bg(uid, ckey, sym_list):
-                try:
-                    import concurrent.futures as _cf
-                    import logging as _log
-                    from datetime import datetime as _dt
-                    from datetime import timedelta as _td
-
-                    import pandas as _pd
-                    import pandas_ta as _ta
-                    import pytz as _pytz
-                    import yfinance as _yf
-                    from django.contrib.auth import get_user_model
-                    from django.core.cache import cache as _c
-
-                    from stocks.models import CupHandleCandidate as _CHC
-                    from stocks.utils import detect_cup_and_handle
-                    _uch_log = _log.getLogger('stocks.us_cup_handle')
-
-                    User      = get_user_model()
-                    user      = User.objects.get(pk=uid)
-                    _now      = _dt.now(_pytz.utc)
-                    _end_str  = _now.date().strftime('%Y-%m-%d')
-                    _start    = (_now.date() - _td(days=600)).strftime('%Y-%m-%d')
-                    _scan_run = _dt.now(_pytz.utc)
-
-                    # เก็บ 3 รอบล่าสุด ลบเก่า
-                    old_runs = list(
-                        _CHC.objects.filter(user=user, market='US')
-                        .values_list('scan_run', flat=True)
-                        .distinct().order_by('-scan_run')[2:]
-                    )
-                    if old_runs:
-                        _CHC.objects.filter(user=user, market='US', scan_run__in=old_runs).delete()
-
-                    total   = len(sym_list)
-                    results = []
-
-                    def _scan_one(symbol):
-                        try:
-                            df = _yf.Ticker(symbol).history(start=_start, end=_end_str, interval='1d')
-                            if df is None or df.empty or len(df) < 60:
-                                return None
-                            if isinstance(df.columns, _pd.MultiIndex):
-                                df.columns = df.columns.droplevel(1)
-                            df = df.dropna(subset=['Close', 'High', 'Low'])
-
-                            # Liquidity filter - USD (≥$1M daily turnover)
-                            avg_vol   = float(df['Volume'].tail(20).mean())
-                            avg_price = float(df['Close'].tail(20).mean())
-                            if avg_vol * avg_price < 1_000_000:
-                                return None
-
-                            pat = detect_cup_and_handle(df)
-                            if pat is None:
-                                return None
-
-                            # Breakout volume confirmation (O'Neil rule: ≥1.5x avg on breakout day)
-                            breakout_vol_ok = False
-                            if pat['stage'] == 'breakout':
-                                last_vol = float(df['Volume'].iloc[-1])
-                                breakout_vol_ok = last_vol >= avg_vol * 1.5
-
-                            # RS return (3M)
-                            close_s   = df['Close'].dropna()
-                            rs_return = None
-                            if len(close_s) >= 66:
-                                rs_return = float(
-                                    (close_s.iloc[-1] - close_s.iloc[-66]) / abs(close_s.iloc[-66]) * 100
-                                )
-
-                            # ADX & RSI
-                            adx_val = 0.0
-                            rsi_val = 50.0
-                            try:
-                                adx_df = _ta.adx(df['High'], df['Low'], df['Close'], length=14)
-                                if adx_df is not None and not adx_df.empty:
-                                    col = [c for c in adx_df.columns if c.startswith('ADX_')]
-                                    if col and _pd.notna(adx_df[col[0]].iloc[-1]):
-                                        adx_val = float(adx_df[col[0]].iloc[-1])
-                                rsi_s = _ta.rsi(df['Close'], length=14)
-                                if rsi_s is not None and _pd.notna(rsi_s.iloc[-1]):
-                                    rsi_val = float(rsi_s.iloc[-1])
-                            except Exception as _e:
-                                _uch_log.debug(f'[US Cup&Handle] ADX/RSI {symbol}: {_e}')
-
-                            return {
-                                'symbol': symbol, 'pat': pat,
-                                'rs_return': rs_return, 'adx': adx_val,
-                                'rsi': rsi_val, 'avg_vol': avg_vol,
-                                'breakout_vol_ok': breakout_vol_ok,
-                            }
-                        except Exception as _e:
-                            _uch_log.debug(f'[US Cup&Handle] scan {symbol}: {_e}')
-                            return None
-
-                    with _cf.ThreadPoolExecutor(max_workers=5) as ex:
-                        futs = {ex.submit(_scan_one, s): s for s in sym_list}
-                        done = 0
-                        for fut in _cf.as_completed(futs):
-                            done += 1
-                            _c.set(ckey, {
-                                'state': 'running', 'progress': done,
-                                'total': total, 'phase': f'สแกน {done}/{total}...'
-                            }, timeout=900)
-                            try:
-                                res = fut.result()
-                                if res:
-                                    results.append(res)
-                            except Exception as _e:
-                                _uch_log.debug(f'[US Cup&Handle] future error {futs[fut]}: {_e}')
-
-                    # RS percentile rank
-                    rs_vals = {r['symbol']: r['rs_return'] for r in results if r['rs_return'] is not None}
-                    rs_map  = {}
-                    if rs_vals:
-                        rs_ser = _pd.Series(rs_vals)
-                        rs_map = (rs_ser.rank(pct=True) * 99).clip(0, 99).astype(int).to_dict()
-
-                    # Save to DB
-                    for res in results:
-                        pat = res['pat']
-                        _CHC.objects.create(
-                            user=user, scan_run=_scan_run, market='US',
-                            symbol=res['symbol'],
-                            price=pat['current_price'],
-                            cup_high=pat['cup_high'],
-                            cup_low=pat['cup_low'],
-                            cup_depth_pct=pat['cup_depth_pct'],
-                            cup_length_days=pat['cup_length_days'],
-                            cup_start_date=pat['cup_start_date'],
-                            cup_end_date=pat['cup_end_date'],
-                            handle_high=pat['handle_high'],
-                            handle_low=pat['handle_low'],
-                            handle_depth_pct=pat['handle_depth_pct'],
-                            handle_length_days=pat['handle_length_days'],
-                            handle_start_date=pat['handle_start_date'],
-                            breakout_price=pat['breakout_price'],
-                            target_price=pat['target_price'],
-                            stop_loss=pat['stop_loss'],
-                            risk_reward=pat['risk_reward'],
-                            avg_vol_20d=res['avg_vol'],
-                            cup_vol_confirmed=pat['cup_vol_confirmed'],
-                            handle_vol_dry=pat['handle_vol_dry'],
-                            breakout_vol_ok=res['breakout_vol_ok'],
-                            stage=pat['stage'],
-                            confidence_score=pat['confidence_score'],
-                            rs_rating=rs_map.get(res['symbol'], 0),
-                            adx=res['adx'],
-                            rsi=res['rsi'],
-                        )
-
-                    _c.set(ckey, {'state': 'done'}, timeout=300)
-                except Exception as exc:
-                    import logging
-                    logging.getLogger('stocks').exception(f'[US Cup&Handle] bg scan error: {exc}')
-                    from django.core.cache import cache as _c2
-                    _c2.set(ckey, {'state': 'done'}, timeout=300)
-
-            _th.Thread(
-                target=_run_us_cup_handle_bg,
-                args=(user_id, cache_key, scan_symbols),
-                daemon=True
-            ).start()
-
-        from django.shortcuts import redirect as _redir
-        return _redir('stocks:us_cup_handle_scanner')
-
-    # ── Display results ───────────────────────────────────────────
-    from stocks.models import CupHandleCandidate as _CHC
-
-    all_runs = list(
-        _CHC.objects.filter(user=request.user, market='US')
-        .values_list('scan_run', flat=True)
-        .distinct().order_by('-scan_run')
-    )
-
-    try:
-        run_idx = int(request.GET.get('run_idx', 0))
-    except (ValueError, TypeError):
-        run_idx = 0
-    run_idx = max(0, min(run_idx, len(all_runs) - 1)) if all_runs else 0
-
-    candidates = []
-    scanned_at = None
-    if all_runs:
-        selected_run = all_runs[run_idx]
-        candidates   = list(_CHC.objects.filter(user=request.user, market='US', scan_run=selected_run))
-        scanned_at   = selected_run
-
-    stage_order = {'breakout': 0, 'ready': 1, 'handle': 2, 'forming': 3}
-    candidates.sort(key=lambda c: (stage_order.get(c.stage, 9), -c.confidence_score))
-
-    stage_counts = {
-        'breakout': sum(1 for c in candidates if c.stage == 'breakout'),
-        'ready':    sum(1 for c in candidates if c.stage == 'ready'),
-        'handle':   sum(1 for c in candidates if c.stage == 'handle'),
-        'forming':  sum(1 for c in candidates if c.stage == 'forming'),
-    }
-
-    stage_filter = request.GET.get('stage', 'all')
-    try:
-        min_conf = int(request.GET.get('min_conf', 0))
-    except (ValueError, TypeError):
-        min_conf = 0
-    rs_only = request.GET.get('rs_only') == '1'
-
-    if stage_filter != 'all':
-        candidates = [c for c in candidates if c.stage == stage_filter]
-    if min_conf > 0:
-        candidates = [c for c in candidates if c.confidence_score >= min_conf]
-    if rs_only:
-        candidates = [c for c in candidates if c.rs_rating >= 70]
-
-    for c in candidates:
-        if c.breakout_price > 0 and c.price > 0:
-            c.pct_to_breakout = round((c.breakout_price - c.price) / c.price * 100, 1)
-            c.pct_to_breakout = max(0.0, c.pct_to_breakout)
-        else:
-            c.pct_to_breakout = 0.0
-        if c.cup_high > c.cup_low:
-            raw = (c.price - c.cup_low) / (c.cup_high - c.cup_low) * 100
-            c.recovery_pct = round(min(100.0, max(0.0, raw)), 1)
-        else:
-            c.recovery_pct = 0.0
-
-    forming_list    = [c for c in candidates if c.stage == 'forming']
-    closest_forming = max(forming_list, key=lambda c: c.recovery_pct, default=None)
-
-    context = {
-        'candidates':        candidates,
-        'has_scanned':       bool(all_runs),
-        'scanned_at':        scanned_at,
-        'all_runs':          all_runs,
-        'selected_run_idx':  run_idx,
-        'current_sort':      request.GET.get('sort', 'stage'),
-        'stage_counts':      stage_counts,
-        'stage_filter':      stage_filter,
-        'min_conf':          min_conf,
-        'rs_only':           rs_only,
-        'closest_forming':   closest_forming,
-        'stage_labels': {
-            'breakout': ('Breakout',       '#16a34a'),
-            'ready':    ('Ready to Break', '#2563eb'),
-            'handle':   ('Handle Forming', '#d97706'),
-            'forming':  ('Cup Forming',    '#64748b'),
-        },
-        'total_symbols': len(_US_MOMENTUM_SYMBOLS),
-    }
-    return render(request, 'stocks/us_cup_handle_scan.html', context)
+    return _cup_handle_scanner_view(request, 'US')
 
 
 # ============================================================
@@ -7605,7 +3291,6 @@ def turtle_scanner_run_ajax(request):
 
     import pandas as _pd
     import yfinance as _yf
-    from django.core.cache import cache as _cp
     from django.http import JsonResponse as _JR
     from django.utils import timezone as _tz
 
@@ -7615,7 +3300,7 @@ def turtle_scanner_run_ajax(request):
     market_param = request.GET.get('market', 'SET')
     ckey = f'turtle_scan_{user_id}_{market_param}'
 
-    c_state = _cp.get(ckey, {'state': 'idle'})
+    c_state = _scan_jobs.get(ckey)
     if request.GET.get('status_check') == '1':
         return _JR(c_state)
 
@@ -7666,7 +3351,7 @@ def turtle_scanner_run_ajax(request):
 
         scan_time = _tz.now()
         total_syms = len(syms)
-        _cp.set(ckey, {'state': 'running', 'progress': 0, 'total': total_syms}, timeout=3600)
+        _scan_jobs.update(ckey, {'state': 'running', 'progress': 0, 'total': total_syms})
         
         results = []
         processed = 0
@@ -7675,7 +3360,7 @@ def turtle_scanner_run_ajax(request):
         # ข้าม Stage 1 (YahooQuery) เพื่อความเร็วและป้องกันการค้าง
         candidates = [{'symbol': s} for s in syms]
         total_cand = len(candidates)
-        _cp.set(ckey, {'state': 'running', 'progress': 0, 'total': total_cand, 'phase': f'🐢 กำลังเริ่มวิเคราะห์หุ้น {total_cand} ตัว...'}, timeout=3600)
+        _scan_jobs.update(ckey, {'state': 'running', 'progress': 0, 'total': total_cand, 'phase': f'🐢 กำลังเริ่มวิเคราะห์หุ้น {total_cand} ตัว...'})
         # กำหนดขนาดกลุ่มข้อมูลตามตลาด
         c_size = 20 if market == 'US' else 50
         for i in range(0, len(candidates), c_size):
@@ -7696,11 +3381,12 @@ def turtle_scanner_run_ajax(request):
                 else:
                     chunk_bk.append(s)
             
-            _cp.set(ckey, {'state': 'running', 'progress': i, 'total': total_cand, 'phase': f'กำลังวิเคราะห์กลุ่มที่ {i//c_size + 1}...'}, timeout=3600)
+            _scan_jobs.update(ckey, {'state': 'running', 'progress': i, 'total': total_cand, 'phase': f'กำลังวิเคราะห์กลุ่มที่ {i//c_size + 1}...'})
             
             try:
-                # Use yfinance with auto_adjust
-                data = yf.download(chunk_bk, period="1y", interval="1d", progress=False, group_by='ticker', threads=True, timeout=30, auto_adjust=True)
+                # แท่งราคา 1 ปีจากคลังกลาง (adjusted แล้ว) — ดึงเพิ่มจาก Yahoo เฉพาะส่วนที่ขาด
+                from stocks.bar_store import get_bars
+                data = get_bars(chunk_bk)
                 
                 for symbol in chunk_syms:
                     try:
@@ -7710,7 +3396,7 @@ def turtle_scanner_run_ajax(request):
                         # ให้ข้ามไปเลยถ้า Yahoo หา .BK ไม่เจอ เพราะมักจะเป็นการปนกันของรายชื่อ
                         df = None
                         if s_bk in data and not data[s_bk].empty:
-                            df = data[s_bk].dropna(subset=['Close'])
+                            df = data[s_bk].dropna(subset=['Close']).copy()
                         
                         # Fallback & Sanitization
                         if df is None or df.empty:
@@ -7848,9 +3534,12 @@ def turtle_scanner_run_ajax(request):
         if results:
             TurtleScanCandidate.objects.bulk_create(results)
 
-        _cp.set(ckey, {'state': 'done', 'found': len(results)}, timeout=3600)
+        _scan_jobs.update(ckey, {'state': 'done', 'found': len(results)})
 
-    _cp.set(ckey, {'state': 'running', 'progress': 0, 'total': len(sym_list)}, timeout=3600)
+    if request.GET.get('force') == '1':
+        _scan_jobs.clear(ckey)
+    if not _scan_jobs.start(ckey, user_id, {'state': 'running', 'progress': 0, 'total': len(sym_list)}):
+        return _JR({'status': 'started'})
     _th.Thread(target=_bg_task, args=(sym_list, market_param), daemon=True).start()
 
     return _JR({'status': 'started'})
@@ -7880,8 +3569,8 @@ def debug_scan_symbol(request, symbol):
 
     import pandas as pd
     import pandas_ta as ta
-    import yfinance as yf
 
+    from stocks.bar_store import get_symbol_bars
     from stocks.utils import (
         analyze_momentum_technical_v2,
         find_supply_demand_zones,
@@ -7892,12 +3581,9 @@ def debug_scan_symbol(request, symbol):
     result = {'symbol': symbol, 'sym_bk': sym_bk}
 
     try:
-        df = yf.download(sym_bk, period='1y', interval='1d', progress=False, timeout=20)
+        # อ่านจากคลังแท่งราคาเดียวกับที่ scanner ใช้ เพื่อให้ผล debug ตรงกับผลสแกน
+        df = get_symbol_bars(sym_bk).copy()
         result['rows_fetched'] = len(df)
-        result['is_multindex'] = isinstance(df.columns, pd.MultiIndex)
-
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.droplevel(1)
 
         if df.empty or len(df) < 55:
             result['error'] = f'Not enough data: {len(df)} rows'
@@ -7973,7 +3659,9 @@ def api_backtest_presets(request):
 
     sym_bk = symbol if (symbol.endswith('.BK') or '.' in symbol) else f"{symbol}.BK"
     try:
-        df = yf.Ticker(sym_bk).history(period="3y", interval="1d", timeout=20)
+        from datetime import date as _date, timedelta as _td
+        from stocks.bar_store import get_symbol_bars
+        df = get_symbol_bars(sym_bk, start=_date.today() - _td(days=3 * 365))
     except Exception as e:
         return _JR({'error': f'fetch failed: {e}'}, status=502)
 
@@ -7995,20 +3683,37 @@ def api_backtest_presets_universe(request):
     """
     Backtest ย้อนหลังของเกณฑ์ preset รวมสัญญาณจากหุ้นหลายตัว (universe) เป็น trade pool เดียว
     ให้ sample size มากพอสรุป win rate มาตรฐานของแต่ละ preset ได้ (ต่างจากดูรายตัวที่ sample เล็ก)
-    GET params: limit (จำนวนหุ้น top market cap ที่จะทดสอบ, default 40, max 80)
-    ผลลัพธ์ cache ไว้ 24 ชม. ต่อ limit เพราะดึงข้อมูลราคาหลายสิบตัวจาก yfinance ใช้เวลานาน
+    GET params: limit (จำนวนหุ้น top market cap ที่จะทดสอบ, default 40, max 400)
+                sl, rr, hold (optional, คั่นด้วย comma เช่น sl=2,3,5&rr=1.5,2&hold=10,20)
+                  ถ้าส่งมา จะคืน sweep ทุกชุดพารามิเตอร์ × ทุก preset เพิ่มจาก results ค่า default
+    ผลลัพธ์ cache ไว้ 24 ชม. ต่อ limit + grid
     """
     from django.core.cache import cache
     from django.http import JsonResponse as _JR
     from stocks.models import ScannableSymbol
-    from stocks.utils import run_all_presets_backtest_universe
+    from stocks.backtest_engine import run_presets_sweep_universe
 
     try:
-        limit = min(int(request.GET.get('limit', 40)), 80)
+        limit = min(int(request.GET.get('limit', 40)), 400)
     except (TypeError, ValueError):
         limit = 40
 
-    cache_key = f'backtest_presets_universe_v1_{limit}'
+    def _grid_param(name, cast, default, max_items=6):
+        raw = request.GET.get(name, '')
+        try:
+            values = sorted({cast(v) for v in raw.split(',') if v.strip()})
+        except (TypeError, ValueError):
+            values = []
+        values = [v for v in values if v > 0][:max_items]
+        return tuple(values) or (default,)
+
+    sl_pcts = _grid_param('sl', float, 3.0)
+    rr_targets = _grid_param('rr', float, 1.5)
+    hold_days = tuple(sorted({min(h, 120) for h in _grid_param('hold', int, 20)}))
+    is_sweep = any(request.GET.get(p) for p in ('sl', 'rr', 'hold'))
+
+    grid_tag = '_'.join(','.join(str(v) for v in vals) for vals in (sl_pcts, rr_targets, hold_days))
+    cache_key = f'backtest_presets_universe_v2_{limit}_{grid_tag}'
     cached = cache.get(cache_key)
     if cached is not None:
         cached['cached'] = True
@@ -8022,21 +3727,27 @@ def api_backtest_presets_universe(request):
     if not symbols:
         return _JR({'error': 'no symbols available to test'}, status=404)
 
-    symbol_dfs = {}
-    for sym in symbols:
-        sym_bk = sym if (sym.endswith('.BK') or '.' in sym) else f"{sym}.BK"
-        try:
-            df = yf.Ticker(sym_bk).history(period="3y", interval="1d", timeout=20)
-            if df is not None and not df.empty:
-                symbol_dfs[sym] = df
-        except Exception:
-            continue
+    # ดึงแท่งราคา 3 ปีของทั้ง universe ในครั้งเดียวจากคลังกลาง (Yahoo เฉพาะส่วนที่ขาด)
+    from datetime import date as _date, timedelta as _td
+    from stocks.bar_store import get_bars
+    sym_map = {sym: (sym if (sym.endswith('.BK') or '.' in sym) else f"{sym}.BK") for sym in symbols}
+    bars = get_bars(list(sym_map.values()), start=_date.today() - _td(days=3 * 365))
+    symbol_dfs = {sym: bars[s_bk] for sym, s_bk in sym_map.items() if s_bk in bars and not bars[s_bk].empty}
 
     if not symbol_dfs:
         return _JR({'error': 'failed to fetch price data for universe symbols'}, status=502)
 
-    results = run_all_presets_backtest_universe(symbol_dfs)
+    # sweep รวมชุด default (3% / 1.5R / 20 วัน) ไว้ด้วยเสมอ — results เดิมดึงจากชุดนั้น ไม่ต้องรันซ้ำ
+    sweep = run_presets_sweep_universe(symbol_dfs,
+                                       sl_pcts=tuple(sorted({3.0, *sl_pcts})),
+                                       rr_targets=tuple(sorted({1.5, *rr_targets})),
+                                       max_hold_days=tuple(sorted({20, *hold_days})))
+    results = [r for r in sweep if (r['sl_pct'], r['rr_target'], r['max_hold_days']) == (3.0, 1.5, 20)]
     payload = {'universe_size': len(symbol_dfs), 'requested_limit': limit, 'results': results, 'cached': False}
+    if is_sweep:
+        payload['sweep'] = [r for r in sweep
+                            if r['sl_pct'] in sl_pcts and r['rr_target'] in rr_targets
+                            and r['max_hold_days'] in hold_days]
     cache.set(cache_key, payload, timeout=60 * 60 * 24)
     return _JR(payload)
 
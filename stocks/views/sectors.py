@@ -1,7 +1,7 @@
 ﻿from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, Count, Q, Max
-from stocks.models import PrecisionScanCandidate
+from django.db.models import Avg, Count, Q, Max, OuterRef, Subquery
+from stocks.models import PrecisionScanCandidate, RelativeStrengthSnapshot, ScannableSymbol
 
 @login_required
 def sector_rotation_dashboard(request):
@@ -12,6 +12,21 @@ def sector_rotation_dashboard(request):
     
     sectors_data = []
     last_updated = None
+
+    # RS เฉลี่ยของทั้ง sector (ทุกหุ้นในตลาด ไม่ใช่แค่ตัวที่ผ่านสแกน) — join snapshot ล่าสุดกับ sector ของ ScannableSymbol
+    from stocks.rs_engine import latest_snapshot_date
+    sector_rs = {}
+    rs_date = latest_snapshot_date(market)
+    if rs_date:
+        sector_rs = dict(
+            RelativeStrengthSnapshot.objects.filter(market=market, date=rs_date)
+            .annotate(sector=Subquery(
+                ScannableSymbol.objects.filter(market=market, symbol=OuterRef('symbol')).values('sector')[:1]
+            ))
+            .values('sector')
+            .annotate(avg_rs=Avg('rs_rating'))
+            .values_list('sector', 'avg_rs')
+        )
     
     if latest_run:
         last_updated = latest_run
@@ -36,7 +51,9 @@ def sector_rotation_dashboard(request):
             stage2_ratio = (stage2_count / total_stocks) * 100
             
             avg_tech = sec_qs.aggregate(Avg('technical_score'))['technical_score__avg'] or 0
-            avg_rs = sec_qs.aggregate(Avg('rs_rating'))['rs_rating__avg'] or 0
+            avg_rs = sector_rs.get(s_name)
+            if avg_rs is None:
+                avg_rs = sec_qs.aggregate(Avg('rs_rating'))['rs_rating__avg'] or 0
             
             top_stocks = sec_qs.order_by('-technical_score', '-rs_rating')[:5]
             
@@ -7,10 +7,11 @@
 - จัดกลุ่มงานตามวันที่นัดหมายและคำนวณช่วงเวลา
 - ส่งการแจ้งเตือนไปยัง Google Chat และ LINE
 """
-import datetime
 import json
 import logging
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from django.conf import settings
@@ -84,14 +85,13 @@ def _ai_suggest_team(task_type, teams):
         ServiceTeam ที่ AI แนะนำ หรือผลลัพธ์จาก _fallback_suggest_team
     """
     try:
-        import google.genai as genai
-        api_key = settings.GEMINI_API_KEY
-        # สร้าง Gemini client ด้วย API key จาก settings
-        client = genai.Client(api_key=api_key)
+        from utils.llm_gateway import generate as llm_generate
 
-        # สร้างข้อมูลสรุปของทีมแต่ละทีม รวมถึงทักษะและภาระงานที่มีอยู่
+        # สร้างข้อมูลสรุปของทีมแต่ละทีม รวมถึงทักษะและภาระงานที่มีอยู่ (ภาระงานจาก TeamDayLoad ใน query เดียว)
+        from pms.team_load import team_loads
+        loads = team_loads([t.pk for t in teams])
         team_info = "\n".join([
-            f"- Team '{t.name}': skills={t.skills}, current load={t.tasks.filter(status__in=['SCHEDULED','IN_PROGRESS']).count()}/{t.max_tasks_per_day}"
+            f"- Team '{t.name}': skills={t.skills}, current load={loads[t.pk]}/{t.max_tasks_per_day}"
             for t in teams
         ])
 
@@ -104,16 +104,12 @@ Available teams:
 
 Pick the best team name. Reply with ONLY the team name, nothing else."""
 
-        response = client.models.generate_content(
-            model='gemini-3-flash-preview',
-            contents=prompt
-        )
-        # ดึงชื่อทีมจาก response และตัดช่องว่างออก
-        suggested_name = response.text.strip()
+        # ภาระงานอยู่ใน prompt — prompt เดิมจึงหมายถึงสถานการณ์เดิม cache ได้ตามอายุ use case 'team_suggest'
+        suggested_name = llm_generate(prompt, use_case='team_suggest', model='gemini-3-flash-preview').strip()
 
         # จับคู่ชื่อทีมที่ AI แนะนำกับ object ทีมในระบบ
         # ใช้การเปรียบเทียบแบบ case-insensitive และรองรับทั้ง substring matching
-        for t in teams:
+        for t in teams if suggested_name else []:
             if t.name.lower() in suggested_name.lower() or suggested_name.lower() in t.name.lower():
                 return t
     except Exception as e:
@@ -124,6 +120,36 @@ Pick the best team name. Reply with ONLY the team name, nothing else."""
     return _fallback_suggest_team(task_type, teams)
 
 
+def _team_skill_map(teams):
+    """
+    {team_id: [skill_type]} ของหลายทีมใน query เดียว — ผลเหมือน ServiceTeam.skill_list()
+    (team_skills ที่ active ก่อน ถ้าไม่มีใช้ skills แบบ comma-string เดิม)
+    """
+    from pms.models import ServiceTeam
+
+    from_m2m = {}
+    rows = ServiceTeam.team_skills.through.objects.filter(
+        serviceteam_id__in=[t.pk for t in teams], skill__is_active=True,
+    ).order_by('skill__skill_type', 'skill__name').values_list('serviceteam_id', 'skill__skill_type')
+    for team_id, skill_type in rows:
+        from_m2m.setdefault(team_id, []).append(skill_type)
+    return {
+        t.pk: list(dict.fromkeys(from_m2m[t.pk])) if t.pk in from_m2m
+        else [s.strip() for s in t.skills.split(',') if s.strip()]
+        for t in teams
+    }
+
+
+def _within_box(lat, lng, job_lat, job_lng, radius_km):
+    """
+    Spatial pre-filter: อยู่ในกรอบสี่เหลี่ยมรอบจุดงาน (±radius_km) หรือไม่ — เทียบองศาตรงๆ ไม่ต้องใช้ตรีโกณ
+    ทีมที่หลุดกรอบอยู่ไกลเกิน radius_km แน่นอน ไม่ต้องคำนวณ haversine
+    """
+    dlat = radius_km / 111.0
+    dlng = radius_km / max(111.32 * math.cos(math.radians(job_lat)), 1e-6)
+    return abs(lat - job_lat) <= dlat and abs(lng - job_lng) <= dlng
+
+
 def _fallback_suggest_team(task_type, teams, job_lat=None, job_lng=None):
     """
     Fallback logic สำหรับกรณีที่ AI ไม่พร้อมใช้งาน
@@ -135,6 +161,9 @@ def _fallback_suggest_team(task_type, teams, job_lat=None, job_lng=None):
        - ระยะ ≤ 50 km  → +4 คะแนน
        - ระยะ ≤ 100 km → +2 คะแนน
 
+    ภาระงานอ่านจาก TeamDayLoad และทักษะของทุกทีมดึงใน query เดียว — ไม่ query ต่อทีม
+    ทีมที่อยู่นอกกรอบ 100 km รอบงานถูกตัดทิ้งก่อนคำนวณ haversine
+
     Args:
         task_type (str): ประเภทงานที่ต้องการจับคู่กับทักษะทีม
         teams (list): รายการทีมทั้งหมด
@@ -144,31 +173,39 @@ def _fallback_suggest_team(task_type, teams, job_lat=None, job_lng=None):
     Returns:
         ServiceTeam ที่มีคะแนนสูงสุด หรือ None หากไม่มีทีมที่ active
     """
+    from pms.team_load import team_loads
+
+    # ข้ามทีมที่ถูก deactivate แล้ว
+    teams = [team for team in teams if team.is_active]
+    if not teams:
+        return None
+
     use_distance = job_lat is not None and job_lng is not None
+    loads = team_loads([team.pk for team in teams])
+    skills = _team_skill_map(teams)
     best = None
     best_score = -1
 
     for team in teams:
-        # ข้ามทีมที่ถูก deactivate แล้ว
-        if not team.is_active:
-            continue
         # คำนวณคะแนนเริ่มต้นจากจำนวน slot ที่ยังว่างอยู่
-        score = team.max_tasks_per_day - team.tasks.filter(status__in=['SCHEDULED', 'IN_PROGRESS']).count()
+        score = team.max_tasks_per_day - loads[team.pk]
         # ถ้าทีมมีทักษะตรงกับประเภทงาน ให้คะแนนโบนัสเพิ่ม 10 คะแนน
-        if task_type in team.skill_list():
+        if task_type in skills[team.pk]:
             score += 10
         # คะแนนระยะทาง: ทีมที่อยู่ใกล้งานได้คะแนนเพิ่ม
         if use_distance and team.latitude is not None and team.longitude is not None:
             try:
-                dist_km = haversine(float(team.latitude), float(team.longitude), job_lat, job_lng)
-                if dist_km <= 20:
-                    score += 8
-                elif dist_km <= 50:
-                    score += 4
-                elif dist_km <= 100:
-                    score += 2
-                # บันทึก log เพื่อ debug
-                logger.debug(f"Team '{team.name}': dist={dist_km:.1f} km to job site")
+                lat, lng = float(team.latitude), float(team.longitude)
+                if _within_box(lat, lng, job_lat, job_lng, 100):
+                    dist_km = haversine(lat, lng, job_lat, job_lng)
+                    if dist_km <= 20:
+                        score += 8
+                    elif dist_km <= 50:
+                        score += 4
+                    elif dist_km <= 100:
+                        score += 2
+                    # บันทึก log เพื่อ debug
+                    logger.debug(f"Team '{team.name}': dist={dist_km:.1f} km to job site")
             except Exception as e:
                 logger.debug(f"Distance calc failed for team '{team.name}': {e}")
         # อัปเดตทีมที่ดีที่สุดหากพบทีมที่มีคะแนนสูงกว่า
@@ -180,95 +217,205 @@ def _fallback_suggest_team(task_type, teams, job_lat=None, job_lng=None):
 
 
 # ====== ส่วนซิงค์ Project เข้า Service Queue ======
+# เดิม post_save ของ Project เรียก sync_projects_to_queue() ทุกครั้งที่บันทึกโครงการใดๆ — กวาด select_for_update
+# ทุกโครงการ QUEUE_* + query รายโครงการ + อาจเรียก Gemini แบบ synchronous อยู่ใน transaction ของ request ผู้ใช้
+# ตอนนี้ post_save ประมวลผลเฉพาะโครงการที่ถูกบันทึก (sync_project_to_queue) ส่วนการแนะนำทีมส่งเข้า worker
+# เบื้องหลังหลัง commit แล้วเขียนทีมกลับลง ServiceQueueItem ทีหลัง — แก้โครงการเดียวใช้ query คงที่ไม่ว่าคิวจะยาวแค่ไหน
+
+ACTIVE_QUEUE_STATUSES = ['PENDING', 'SCHEDULED', 'IN_PROGRESS', 'INCOMPLETE']
+
+# Map job_type → ServiceQueueItem.TaskType for the queue card label
+_TASK_TYPE_MAP = {
+    'PROJECT': 'INSTALLATION',
+    'REPAIR':  'REPAIR',
+    'SERVICE': 'DELIVERY',
+    'SURVEY':  'SURVEY',
+}
+
+# worker เดียวพอ — งานแนะนำทีมต่อคิวกันทีละงาน ไม่ยิง Gemini พร้อมกันหลายตัว
+_team_executor = None
+_team_executor_lock = threading.Lock()
+
+
+def is_queue_status(status) -> bool:
+    """Convention: any project whose status_key starts with QUEUE_ enters the AI Queue"""
+    return bool(status) and status.upper().startswith('QUEUE_')
+
+
+def _create_queue_item(proj):
+    """สร้าง ServiceQueueItem (PENDING) ของ project — ยังไม่ใส่ทีม (worker เบื้องหลังจะเติมให้)"""
+    from pms.models import JobStatus, ServiceQueueItem
+
+    task_type = _TASK_TYPE_MAP.get(proj.job_type, 'OTHER')
+    # Use the JobStatus label as the queue card title
+    js = JobStatus.objects.filter(
+        job_type=proj.job_type, status_key=proj.status, is_active=True
+    ).first()
+    label = js.label if js else proj.status
+
+    return ServiceQueueItem.objects.create(
+        title=f"{label} · {proj.name}",
+        description=f"ลูกค้า: {proj.customer.name}\n{proj.description or ''}".strip(),
+        project=proj,
+        task_type=task_type,
+        priority='NORMAL',
+        deadline=proj.deadline,
+        status='PENDING',
+    )
+
+
+def _dedupe_active_items(project_ids):
+    """เก็บ item ที่ active ล่าสุดไว้ตัวเดียวต่อ project ลบตัวที่ซ้ำ — Returns: set ของ project_id ที่มี item แล้ว"""
+    from pms.models import ServiceQueueItem
+
+    keep, duplicates = set(), []
+    rows = (
+        ServiceQueueItem.objects
+        .filter(project_id__in=project_ids, status__in=ACTIVE_QUEUE_STATUSES)
+        .order_by('project_id', '-updated_at')
+        .values_list('pk', 'project_id')
+    )
+    for pk, project_id in rows:
+        if project_id in keep:
+            duplicates.append(pk)
+        else:
+            keep.add(project_id)
+    if duplicates:
+        ServiceQueueItem.objects.filter(pk__in=duplicates).delete()
+    return keep
+
+
+def sync_project_to_queue(project):
+    """
+    ซิงค์ Project เดียวเข้าคิวงาน (เรียกจาก post_save ของ Project)
+    - สถานะไม่ใช่ QUEUE_* → ไม่ทำอะไร
+    - มี item ที่ active อยู่แล้ว → ลบตัวที่ซ้ำ (ถ้ามี) แล้วจบ
+    - ยังไม่มี → สร้าง item ใหม่ แล้วส่งงานแนะนำทีมเข้า worker เบื้องหลังหลัง transaction commit
+
+    Returns:
+        ServiceQueueItem ที่สร้างใหม่ หรือ None
+    """
+    from pms.models import Project
+
+    if not is_queue_status(project.status):
+        return None
+
+    with transaction.atomic():
+        # ล็อกเฉพาะแถวของ project นี้ — กันการบันทึกพร้อมกัน 2 request สร้าง item ซ้ำ
+        proj = Project.objects.select_for_update().select_related('customer').filter(pk=project.pk).first()
+        if proj is None or not is_queue_status(proj.status):
+            return None
+        if _dedupe_active_items([proj.pk]):
+            return None
+        item = _create_queue_item(proj)
+
+    enqueue_team_suggestion(item.pk)
+    return item
+
 
 @transaction.atomic
 def sync_projects_to_queue():
     """
-    ซิงค์ข้อมูล Projects ที่พร้อมเข้าสู่ระบบคิวงาน (ServiceQueueItem)
-    ใช้ @transaction.atomic เพื่อให้การทำงานทั้งหมดเป็น atomic (ถ้าล้มเหลวจะ rollback ทั้งหมด)
+    กวาดซิงค์ Projects ทั้งหมดที่พร้อมเข้าสู่ระบบคิวงาน (ServiceQueueItem)
+    ใช้กับปุ่ม "กวาดตรวจข้อมูล" และหน้า Dashboard — เก็บตกโครงการที่เปลี่ยนสถานะโดยไม่ผ่าน save()
+    (เช่น QuerySet.update()) งานปกติถูกซิงค์ทีละโครงการผ่าน sync_project_to_queue แล้ว
 
     กฎการซิงค์:
-    1. ลบ ServiceQueueItem ที่ไม่มี project แล้ว หรือ project ออกจาก trigger statuses
-       ยกเว้น item ที่มีสถานะ COMPLETED หรือ CANCELLED แล้ว
+    1. project ที่มี item active มากกว่า 1 ตัว → เก็บตัวล่าสุด ลบที่เหลือ
     2. สร้าง ServiceQueueItem ใหม่สำหรับ project ที่ยังไม่มีใน queue
-
-    Trigger Statuses (สถานะที่กระตุ้นให้สร้างคิวงาน):
-    - PROJECT + INSTALLATION
-    - SERVICE + DELIVERY
-    - REPAIR + DELIVERY
+       (ทีมที่แนะนำถูกเติมโดย worker เบื้องหลังหลัง commit)
 
     Returns:
         int: จำนวน ServiceQueueItem ที่สร้างใหม่
     """
-    from django.db.models import Q
+    from pms.models import Project
 
-    from pms.models import JobStatus, Project, ServiceQueueItem, ServiceTeam
+    ready_projects = list(
+        Project.objects.select_for_update().select_related('customer').filter(status__startswith='QUEUE_')
+    )
+    if not ready_projects:
+        return 0
 
-    active_statuses = ['PENDING', 'SCHEDULED', 'IN_PROGRESS', 'INCOMPLETE']
-    teams = list(ServiceTeam.objects.filter(is_active=True))
+    queued = _dedupe_active_items([p.pk for p in ready_projects])
     count = 0
+    for proj in ready_projects:
+        if proj.pk in queued:
+            continue
+        item = _create_queue_item(proj)
+        enqueue_team_suggestion(item.pk)
+        count += 1
 
-    # Convention: any project whose status_key starts with QUEUE_ enters the AI Queue
-    ready_projects = Project.objects.select_for_update().filter(status__startswith='QUEUE_')
+    return count
 
-    if not ready_projects.exists():
-        return 0
 
-    # Map job_type → ServiceQueueItem.TaskType for the queue card label
-    _task_type_map = {
-        'PROJECT': 'INSTALLATION',
-        'REPAIR':  'REPAIR',
-        'SERVICE': 'DELIVERY',
-        'SURVEY':  'SURVEY',
-    }
+# ====== Worker แนะนำทีมเบื้องหลัง ======
 
-    for proj in ready_projects:
-        active_tasks = ServiceQueueItem.objects.filter(
-            project=proj,
-            status__in=active_statuses
-        ).order_by('-updated_at')
-
-        if active_tasks.exists():
-            if active_tasks.count() > 1:
-                for t_del in active_tasks[1:]:
-                    t_del.delete()
-            continue
+def enqueue_team_suggestion(item_id):
+    """ส่ง item เข้าคิวแนะนำทีมหลัง transaction ปัจจุบัน commit (ถ้า rollback จะไม่ถูกส่ง)"""
+    transaction.on_commit(lambda: _get_team_executor().submit(_run_team_suggestion, item_id))
 
-        task_type = _task_type_map.get(proj.job_type, 'OTHER')
-        # Use the JobStatus label as the queue card title
-        js = JobStatus.objects.filter(
-            job_type=proj.job_type, status_key=proj.status, is_active=True
-        ).first()
-        label = js.label if js else proj.status
 
-        # ดึงพิกัดสถานที่ทำงาน (lat/lng) จากลูกค้า เพื่อใช้คำนวณระยะทาง
-        job_lat = job_lng = None
-        try:
-            if proj.customer and proj.customer.latitude and proj.customer.longitude:
-                job_lat = float(proj.customer.latitude)
-                job_lng = float(proj.customer.longitude)
-        except Exception:
-            pass
-
-        # ขอคำแนะนำทีมจาก AI (หรือ fallback logic) เฉพาะเมื่อมีทีมในระบบ
-        suggested_team = get_ai_team_suggestion(task_type, teams, job_lat=job_lat, job_lng=job_lng) if teams else None
-
-        # สร้าง ServiceQueueItem ใหม่พร้อมข้อมูลครบถ้วน
-        item = ServiceQueueItem.objects.create(
-            title=f"{label} · {proj.name}",
-            description=f"ลูกค้า: {proj.customer.name}\n{proj.description or ''}".strip(),
-            project=proj,
-            task_type=task_type,
-            priority='NORMAL',
-            deadline=proj.deadline,
-            status='PENDING',
-        )
-        # assigned_teams เป็น M2M — ต้อง set หลัง create()
-        if suggested_team:
-            item.assigned_teams.set([suggested_team])
-        count += 1
+def _get_team_executor():
+    global _team_executor
+    with _team_executor_lock:
+        if _team_executor is None:
+            _team_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='queue-team')
+        return _team_executor
 
-    return count
+
+def _run_team_suggestion(item_id):
+    from django.db import close_old_connections
+
+    try:
+        assign_suggested_team(item_id)
+    except Exception as e:
+        logger.warning(f"Background team suggestion failed for queue item {item_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+def assign_suggested_team(item_id):
+    """
+    แนะนำทีมให้ ServiceQueueItem (AI หรือ fallback logic) แล้วบันทึกลง assigned_teams
+    ข้ามถ้า item ถูกจัดคิว/ลบไปแล้ว หรือ admin เลือกทีมเองระหว่างรอ
+
+    Returns:
+        ServiceTeam ที่ถูกบันทึก หรือ None
+    """
+    from pms.models import ServiceQueueItem, ServiceTeam
+
+    item = ServiceQueueItem.objects.select_related('project__customer').filter(
+        pk=item_id, status='PENDING'
+    ).first()
+    if item is None or item.assigned_teams.exists():
+        return None
+
+    teams = list(ServiceTeam.objects.filter(is_active=True))
+    if not teams:
+        return None
+
+    # ดึงพิกัดสถานที่ทำงาน (lat/lng) จากลูกค้า เพื่อใช้คำนวณระยะทาง
+    job_lat = job_lng = None
+    try:
+        customer = item.project.customer if item.project else None
+        if customer and customer.latitude and customer.longitude:
+            job_lat = float(customer.latitude)
+            job_lng = float(customer.longitude)
+    except Exception:
+        pass
+
+    # Gemini อาจใช้เวลาหลายวินาที — เรียกนอก transaction แล้วค่อยเขียนผลกลับ
+    suggested_team = get_ai_team_suggestion(item.task_type, teams, job_lat=job_lat, job_lng=job_lng)
+    if suggested_team is None:
+        return None
+
+    with transaction.atomic():
+        item = ServiceQueueItem.objects.select_for_update().filter(pk=item_id, status='PENDING').first()
+        # assigned_teams เป็น M2M — admin อาจเลือกทีมไปแล้วระหว่างที่รอ AI ไม่เขียนทับ
+        if item is None or item.assigned_teams.exists():
+            return None
+        item.assigned_teams.set([suggested_team])
+    return suggested_team
 
 
 # ====== ส่วนจัดตารางเวลางาน (Scheduling) ======
@@ -280,71 +427,72 @@ def schedule_queue_items():
     พร้อมคำนวณช่วงเวลาทำงานโดยอัตโนมัติตามทีมและวันที่
 
     กระบวนการ:
-    1. ดึง item ที่มี scheduled_date และ assigned_team แล้ว
-    2. จัดสรร time slot ให้แต่ละทีมในแต่ละวัน (เริ่มที่ 08:30)
+    1. ดึง item ที่มี scheduled_date และ assigned_team แล้ว (พร้อมทีม/ลูกค้าใน query เดียว)
+    2. อ่านเวลาว่างถัดไปของแต่ละ (ทีม, วัน) จาก TeamDayLoad — วันที่ยังไม่มีงานเริ่มที่ 08:30
+       (รอบก่อนๆ ที่จองไว้แล้วจะไม่ถูกจองทับ)
     3. คำนวณเวลาสิ้นสุดตามประมาณการชั่วโมงทำงานของแต่ละประเภทงาน
-    4. ส่งข้อความแจ้งเตือนไปยังทีม
+    4. บันทึกทุกงานด้วย bulk_update ครั้งเดียว แล้วคำนวณ TeamDayLoad ของวันที่ถูกจองใหม่
+    5. ส่งข้อความแจ้งเตือนไปยังทีม
 
     Returns:
         int: จำนวนงานที่ถูก schedule ในครั้งนี้ (0 หากไม่มีงานที่ต้อง schedule)
     """
-    from pms.models import ServiceQueueItem, TeamMessage
+    from pms.models import ServiceQueueItem
+    from pms.team_load import day_slots, estimated_hours, refresh_team_day_loads, to_time
 
     # Get pending items that admin has set a date for
     # ดึงงานที่รอการ schedule: ต้องมี scheduled_date และมีทีมอย่างน้อย 1 ทีม
-    items = ServiceQueueItem.objects.filter(
-        status__in=['PENDING', 'INCOMPLETE'],
-        scheduled_date__isnull=False,
-        assigned_teams__isnull=False,
-    ).prefetch_related('assigned_teams').distinct()
-
-    if not items.exists():
+    # เรียงลำดับงานตามวันที่ > deadline > วันที่สร้าง เพื่อจัดลำดับความสำคัญ
+    items = [
+        item for item in ServiceQueueItem.objects.filter(
+            status__in=['PENDING', 'INCOMPLETE'],
+            scheduled_date__isnull=False,
+            assigned_teams__isnull=False,
+        ).select_related('project__customer').prefetch_related('assigned_teams')
+        .distinct().order_by('scheduled_date', 'deadline', 'created_at')
+        if item.assigned_teams.all()
+    ]
+    if not items:
         return 0
 
-    count = items.count()
-
     # Auto-assign time slots per team per date
-    # ใช้ defaultdict เพื่อติดตาม time slot ของแต่ละทีมในแต่ละวัน
-    # key = (team_id, date), value = {'hour': ชั่วโมงปัจจุบัน, 'min': นาทีปัจจุบัน}
-    # เริ่มต้น slot แรกของทุกทีมที่ 08:30
-    from collections import defaultdict
-    team_date_slots = defaultdict(lambda: {'hour': 8, 'min': 30})
-
-    # เรียงลำดับงานตามวันที่ > deadline > วันที่สร้าง เพื่อจัดลำดับความสำคัญ
-    for item in items.order_by('scheduled_date', 'deadline', 'created_at'):
-        teams = list(item.assigned_teams.all())
-        if not teams:
-            continue
+    # key = (team_id, date), value = นาทีนับจากเที่ยงคืนของ slot ถัดไป
+    keys = {(team.pk, item.scheduled_date) for item in items for team in item.assigned_teams.all()}
+    team_date_slots = day_slots(keys)
 
-        # ประมาณการชั่วโมงทำงานตามประเภทงาน (ชั่วโมง)
-        # REPAIR=2h, INSTALLATION=3h, DELIVERY=1.5h, OTHER=1h
-        est_hours = {'REPAIR': 2.0, 'INSTALLATION': 3.0, 'DELIVERY': 1.5, 'OTHER': 1.0}.get(item.task_type, 1.0)
+    now = timezone.now()
+    for item in items:
+        est_hours = estimated_hours(item.task_type)
 
         # คำนวณ time slot สำหรับทุกทีม — ใช้เวลาเร็วที่สุด (ทีมแรก) เป็น scheduled_time ของงาน
-        first_slot_time = None
-        for team in teams:
-            key = (team.id, item.scheduled_date)
-            slot = team_date_slots[key]
-            if first_slot_time is None:
-                first_slot_time = datetime.time(slot['hour'], slot['min'])
+        first_slot = None
+        for team in item.assigned_teams.all():
+            key = (team.pk, item.scheduled_date)
+            if first_slot is None:
+                first_slot = team_date_slots[key]
             # เลื่อน time slot ของทีมนี้ไปข้างหน้า
-            total_mins = int(est_hours * 60)
-            slot['min'] += total_mins
-            while slot['min'] >= 60:
-                slot['min'] -= 60
-                slot['hour'] += 1
-
-        # กำหนดเวลาเริ่มงานและประมาณการชั่วโมง แล้วบันทึก
-        item.scheduled_time = first_slot_time
+            team_date_slots[key] += int(est_hours * 60)
+
+        # กำหนดเวลาเริ่มงานและประมาณการชั่วโมง (bulk_update ไม่เรียก save() — ใส่ค่าที่ save() จะตั้งให้เอง)
+        item.scheduled_time = to_time(first_slot)
         item.estimated_hours = est_hours
         item.status = 'SCHEDULED'
-        item.save()
+        item.completed_at = None
+        item.updated_at = now
+
+    with transaction.atomic():
+        ServiceQueueItem.objects.bulk_update(
+            items, ['scheduled_time', 'estimated_hours', 'status', 'completed_at', 'updated_at'], batch_size=500,
+        )
+        refresh_team_day_loads(keys)
+    for item in items:
+        item._old_schedule = item.schedule_state()
 
     # ส่งข้อความแจ้งเตือนไปยังทีมทั้งหมดที่ได้รับมอบหมายงาน
     # Send team messages grouped by date
     _send_schedule_messages(items)
 
-    return count
+    return len(items)
 
 
 # ====== ส่วนส่งข้อความแจ้งเตือน ======
@@ -419,18 +567,21 @@ def _send_schedule_messages(items):
     """
     from collections import defaultdict
 
-    from pms.models import ServiceTeam, TeamMessage
+    from pms.models import TeamMessage
 
     _PRIORITY = {'CRITICAL': ' 🚨', 'HIGH': ' ⚡', 'NORMAL': '', 'LOW': ''}
 
     # Group by (team_id, scheduled_date)
     groups: dict = defaultdict(list)
+    teams: dict = {}
     for item in items:
         for team in item.assigned_teams.all():
+            teams[team.id] = team
             groups[(team.id, item.scheduled_date)].append(item)
 
+    messages = []
     for (team_id, date), tasks in groups.items():
-        team = ServiceTeam.objects.get(id=team_id)
+        team = teams[team_id]
 
         SEP = '─' * 32
         lines = [
@@ -459,15 +610,22 @@ def _send_schedule_messages(items):
 
         lines += [f"\n{SEP}", f"ทีม {team.name}  ·  รวม {len(tasks)} งาน"]
 
-        msg = TeamMessage.objects.create(
+        messages.append((TeamMessage(
             team=team,
             subject=f"📋 คิวงาน {date.strftime('%d/%m/%Y')} · ทีม {team.name} ({len(tasks)} งาน)",
             content="\n".join(lines),
-        )
-        msg.related_tasks.set(tasks)
+        ), tasks))
+
+    # บันทึกข้อความทุกทีมพร้อม related_tasks ด้วย bulk_create (ไม่ create/set ทีละข้อความ)
+    TeamMessage.objects.bulk_create([msg for msg, _ in messages])
+    TeamMessage.related_tasks.through.objects.bulk_create([
+        TeamMessage.related_tasks.through(teammessage_id=msg.pk, servicequeueitem_id=task.pk)
+        for msg, tasks in messages for task in tasks
+    ])
 
+    for msg, _ in messages:
         try:
-            _post_external_notifications(team, msg.subject, msg.content)
+            _post_external_notifications(msg.team, msg.subject, msg.content)
         except Exception as e:
             logger.error(f"Failed to post external notifications: {e}")
 
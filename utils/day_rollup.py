@@ -0,0 +1,55 @@
+"""
+# ====== Day Rollup — ล็อกและเลื่อนการคำนวณตารางสรุปรายวันไปหลัง commit ======
+ตารางสรุปรายวัน (pos/sales_summary.py, pms/gps_rollup.py, pms/sales_facts.py, repairs/analytics.py) คำนวณวันใหม่ด้วย
+ลบแถวของวันแล้ว bulk_create — เดิมไม่มีการล็อก: สองทรานแซกชันที่คำนวณวันเดียวกันพร้อมกัน (เช่นสองเครื่องคิดเงิน)
+ชน unique ของตารางสรุป → IntegrityError และ signal ที่เรียกคำนวณทุก save คำนวณวันเดิมซ้ำหลายรอบในทรานแซกชันเดียว
+
+โมดูลนี้:
+- lock(namespace, keys): ล็อกวัน (pg_advisory_xact_lock) จนจบทรานแซกชันปัจจุบัน — ผู้คำนวณวันเดียวกันต่อคิวกัน
+  และอ่านข้อมูลที่ commit แล้วล่าสุดหลังได้ล็อก (backend อื่นไม่ล็อก — SQLite เขียนได้ทีละทรานแซกชันอยู่แล้ว)
+- on_commit(func, items): รวมรายการที่ต้องคำนวณใหม่ของทรานแซกชันเดียวกัน เรียก func(items) ครั้งเดียวหลัง commit
+  แบบ robust — คำนวณพลาดแค่ log ไว้ (แก้ได้ด้วยคำสั่ง rebuild ของแต่ละตาราง) ไม่ทำให้ request ที่ commit แล้วล้ม
+"""
+import zlib
+
+
+def lock(namespace, keys, using=None):
+    """ต้องเรียกใน transaction.atomic() — keys: ค่าที่ str() ได้ เช่น date หรือ (user_id, date)"""
+    from django.db import transaction
+
+    connection = transaction.get_connection(using)
+    if connection.vendor != 'postgresql':
+        return
+    # เรียงก่อนล็อก — สองทรานแซกชันที่ล็อกหลายวันพร้อมกันจะไม่ deadlock
+    ids = sorted({zlib.crc32(f'{namespace}:{key}'.encode()) for key in keys})
+    with connection.cursor() as cursor:
+        for lock_id in ids:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [zlib.crc32(namespace.encode()) >> 1, lock_id >> 1])
+
+
+def on_commit(func, items, using=None):
+    """
+    items: รายการ hashable (วัน หรือ (user_id, วัน)) — เรียกซ้ำในทรานแซกชันเดียวกันจะเพิ่มเข้าชุดเดิม
+    นอก atomic block: เรียก func ทันที (เหมือน transaction.on_commit)
+    """
+    from django.db import transaction
+
+    items = set(items)
+    if not items:
+        return
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block:
+        # ชุดที่ลงทะเบียนไว้แล้วในทรานแซกชันนี้ (Django ทิ้ง callback ของทรานแซกชัน / savepoint ที่ rollback ให้เอง)
+        for _sids, callback, _robust in connection.run_on_commit:
+            if getattr(callback, 'rollup_func', None) is func:
+                callback.rollup_items.update(items)
+                return
+
+    def refresh():
+        refresh.rollup_func = None  # เริ่มคำนวณแล้ว — รายการที่มาหลังจากนี้ต้องลงทะเบียนชุดใหม่
+        func(refresh.rollup_items)
+
+    refresh.rollup_func = func
+    refresh.rollup_items = items
+    refresh.__qualname__ = getattr(func, '__qualname__', refresh.__qualname__)  # ใช้ใน log ของ Django ตอนคำนวณพลาด
+    transaction.on_commit(refresh, using=using, robust=True)
@@ -0,0 +1,458 @@
+"""
+# ====== LLM Gateway — จุดเดียวสำหรับเรียก Gemini ทั้งระบบ ======
+เดิมแต่ละ view / utility สร้าง genai.Client ใหม่แล้วเรียก generate_content เองใน request thread
+(stocks, pms, chatbot, ops, ai_service_manager) — prompt เดียวกันที่กดซ้ำ / เปิดพร้อมกันหลายแท็บ
+ถูกส่งไป Gemini ซ้ำทุกครั้ง และไม่มีอะไรจำกัดจำนวน request ที่ค้างรอ API พร้อมกัน
+
+โมดูลนี้:
+- generate(prompt, use_case=..., model=..., user=...) → ข้อความคำตอบ (raise เมื่อเรียกไม่สำเร็จ เหมือน genai เดิม)
+- cache คำตอบตาม hash ของ (model, prompt, config) อายุตาม use case (LLM_CACHE_TTLS — 0 = ไม่ cache)
+  ที่เก็บ: Django cache (ค่าเริ่มต้น) หรือ AnalysisCache (LLM_CACHE_STORE='analysis_cache')
+- single-flight: prompt เดียวกันที่กำลังรอคำตอบอยู่ ไม่ส่งซ้ำ — request ที่ตามมารอผลของตัวแรก
+- จำกัดจำนวนการเรียกพร้อมกันทั้ง process (LLM_MAX_CONCURRENCY) และต่อผู้ใช้ (LLM_MAX_CONCURRENCY_PER_USER)
+  รอคิวเกิน LLM_QUEUE_TIMEOUT วินาที → LLMBusyError
+- metrics ต่อ use case: จำนวนเรียก / cache hit / coalesced / error / token / เวลารวม (metrics_snapshot)
+- stream(...): เหมือน generate แต่ yield ข้อความทีละส่วนตามที่โมเดลตอบ (ใช้กับ SSE — utils/llm_stream.py)
+- backend: GeminiBackend (ใช้ genai.Client ตัวเดียวทั้ง process) หรือ FakeBackend (LLM_BACKEND='fake' — ใช้ test / offline)
+"""
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+# อายุ cache (วินาที) ต่อ use case — override ได้ด้วย settings.LLM_CACHE_TTLS
+DEFAULT_TTLS = {
+    'stock_analysis': 60 * 60,
+    'commodity_analysis': 60 * 60,
+    'stock_advisor': 15 * 60,
+    'precision_scan': 30 * 60,
+    'morning_briefing': 30 * 60,
+    'macro_analysis': 60 * 60,
+    'portfolio_analysis': 15 * 60,
+    'chart_analysis': 30 * 60,
+    'pms_report': 30 * 60,
+    'team_suggest': 10 * 60,
+    'ops_report': 30 * 60,
+    'ops_agent': 10 * 60,
+    'investment_dashboard': 30 * 60,
+    'ai_manual_scan': 15 * 60,
+    'daily_agent_report': 30 * 60,
+    'stock_recommendations': 60 * 60,
+    'stock_sentiment': 60 * 60,
+    'crew_analysis': 60 * 60,
+    'chatbot': 0,  # ใช้ tools ดึงข้อมูลสด — ห้าม cache
+}
+
+
+class LLMBusyError(RuntimeError):
+    """รอคิวเรียก LLM นานเกิน LLM_QUEUE_TIMEOUT"""
+
+
+class LLMResponse:
+    __slots__ = ('text', 'prompt_tokens', 'output_tokens')
+
+    def __init__(self, text, prompt_tokens=0, output_tokens=0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+
+
+# ====== Backends ======
+
+class GeminiBackend:
+    """google-genai — client ตัวเดียวใช้ร่วมกันทุก thread ของ process"""
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import google.genai as genai
+
+                    self._client = genai.Client(api_key=self.api_key or settings.GEMINI_API_KEY)
+        return self._client
+
+    @staticmethod
+    def _kwargs(model, prompt, config):
+        kwargs = {'model': model, 'contents': prompt}
+        if config is not None:
+            kwargs['config'] = config
+        return kwargs
+
+    @staticmethod
+    def _response(response):
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResponse(
+            response.text or '',
+            getattr(usage, 'prompt_token_count', 0) or 0,
+            getattr(usage, 'candidates_token_count', 0) or 0,
+        )
+
+    def generate(self, model, prompt, config=None):
+        return self._response(self.client().models.generate_content(**self._kwargs(model, prompt, config)))
+
+    def stream(self, model, prompt, config=None):
+        """yield LLMResponse ทีละส่วน — จำนวน token อยู่ในส่วนท้ายๆ (ส่วนก่อนหน้าเป็น 0)"""
+        for chunk in self.client().models.generate_content_stream(**self._kwargs(model, prompt, config)):
+            yield self._response(chunk)
+
+
+class FakeBackend:
+    """
+    backend สำหรับ test / รันแบบ offline — ไม่เรียก network
+    reply: ข้อความคงที่ หรือ callable(model, prompt) → ข้อความ ; delay: หน่วงเวลาจำลอง API (วินาที)
+    calls: (model, prompt) ที่ถูกเรียกจริง (ไม่นับ cache hit / coalesced)
+    """
+
+    def __init__(self, reply=None, delay=0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+
+    chunk_chars = 40
+
+    def _text(self, model, prompt):
+        with self._lock:
+            self.calls.append((model, prompt))
+        if callable(self.reply):
+            return self.reply(model, prompt)
+        if self.reply is not None:
+            return self.reply
+        return f'[{model}] {prompt[:200]}'
+
+    def generate(self, model, prompt, config=None):
+        if self.delay:
+            time.sleep(self.delay)
+        text = self._text(model, prompt)
+        return LLMResponse(text, len(prompt.split()), len(text.split()))
+
+    def stream(self, model, prompt, config=None):
+        """แบ่งคำตอบเป็นส่วนละ chunk_chars ตัวอักษร — delay กระจายเท่าๆ กันระหว่างส่วน"""
+        text = self._text(model, prompt)
+        parts = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or ['']
+        for i, part in enumerate(parts, 1):
+            if self.delay:
+                time.sleep(self.delay / len(parts))
+            last = i == len(parts)
+            yield LLMResponse(part, len(prompt.split()) if last else 0, len(text.split()) if last else 0)
+
+
+# ====== ที่เก็บ cache ======
+
+class DjangoCacheStore:
+    """Django cache (DatabaseCache — ทุก worker เห็นร่วมกัน)"""
+
+    prefix = 'llm:'
+
+    def get(self, key):
+        from django.core.cache import cache
+
+        return cache.get(self.prefix + key)
+
+    def set(self, key, text, ttl):
+        from django.core.cache import cache
+
+        cache.set(self.prefix + key, text, ttl)
+
+
+class AnalysisCacheStore:
+    """
+    เก็บใน stocks.AnalysisCache (user=None, symbol='llm:<hash>') — ดู / ลบได้จากหน้า admin เดียวกับผลวิเคราะห์อื่น
+    อายุนับจาก last_updated
+    """
+
+    prefix = 'llm:'
+
+    def _symbol(self, key):
+        return self.prefix + key[:16]  # symbol ยาวได้ 20 ตัวอักษร
+
+    def get(self, key):
+        import datetime
+
+        from django.utils import timezone
+        from stocks.models import AnalysisCache
+
+        row = AnalysisCache.objects.filter(user=None, symbol=self._symbol(key)).values_list(
+            'analysis_data', 'last_updated'
+        ).first()
+        if row is None:
+            return None
+        text, stored_at = row
+        expires_at, _, text = text.partition('\n')
+        try:
+            if timezone.now() >= stored_at + datetime.timedelta(seconds=int(expires_at)):
+                return None
+        except ValueError:
+            return None
+        return text
+
+    def set(self, key, text, ttl):
+        from stocks.models import AnalysisCache
+
+        # บรรทัดแรกเก็บอายุ (วินาที) ของรายการนี้
+        AnalysisCache.objects.update_or_create(
+            user=None, symbol=self._symbol(key), defaults={'analysis_data': f'{int(ttl)}\n{text}'},
+        )
+
+
+# ====== Gateway ======
+
+class _Flight:
+    __slots__ = ('done', 'text', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+        self.error = None
+
+
+class LLMGateway:
+    def __init__(self, backend, store=None, max_concurrency=8, max_per_user=2, queue_timeout=90, ttls=None):
+        self.backend = backend
+        self.store = store
+        self.queue_timeout = queue_timeout
+        self.max_per_user = max_per_user
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._user_slots = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    # ── metrics ──
+    def _count(self, use_case, **values):
+        with self._lock:
+            m = self._metrics.setdefault(use_case, {
+                'calls': 0, 'cache_hits': 0, 'coalesced': 0, 'errors': 0,
+                'prompt_tokens': 0, 'output_tokens': 0, 'latency_s': 0.0,
+            })
+            for name, value in values.items():
+                m[name] += value
+
+    def metrics_snapshot(self):
+        with self._lock:
+            return {use_case: dict(m) for use_case, m in self._metrics.items()}
+
+    # ── cache key ──
+    @staticmethod
+    def cache_key(model, prompt, config=None):
+        """None ถ้า config แปลงเป็นข้อความไม่ได้ (เช่นมี tools เป็นฟังก์ชัน) — ไม่ cache / ไม่ coalesce"""
+        config_repr = ''
+        if config is not None:
+            try:
+                config_repr = config.model_dump_json(exclude_none=True) if hasattr(config, 'model_dump_json') else repr(config)
+            except Exception:
+                return None
+        digest = hashlib.sha256()
+        for part in (model, prompt, config_repr):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    # ── concurrency ──
+    def _user_slot(self, user_id):
+        with self._lock:
+            slot = self._user_slots.get(user_id)
+            if slot is None:
+                slot = self._user_slots[user_id] = threading.BoundedSemaphore(self.max_per_user)
+            return slot
+
+    @contextmanager
+    def _slot(self, user_id):
+        """จองที่ของผู้ใช้ แล้วที่ของ process — รอเกิน queue_timeout → LLMBusyError"""
+        user_slot = self._user_slot(user_id) if user_id is not None else None
+        if user_slot is not None and not user_slot.acquire(timeout=self.queue_timeout):
+            raise LLMBusyError('มีคำขอ AI ของผู้ใช้นี้ค้างอยู่หลายรายการ กรุณารอสักครู่')
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise LLMBusyError('ระบบ AI กำลังทำงานเต็มคิว กรุณาลองใหม่อีกครั้ง')
+            try:
+                yield
+            finally:
+                self._slots.release()
+        finally:
+            if user_slot is not None:
+                user_slot.release()
+
+    def _done(self, use_case, model, started, prompt_tokens, output_tokens):
+        elapsed = time.monotonic() - started
+        self._count(use_case, calls=1, latency_s=elapsed, prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+        logger.info("llm %s model=%s %.2fs tokens=%s/%s", use_case, model, elapsed, prompt_tokens, output_tokens)
+
+    def _call(self, use_case, model, prompt, config, user_id):
+        with self._slot(user_id):
+            started = time.monotonic()
+            try:
+                response = self.backend.generate(model, prompt, config)
+            except Exception:
+                self._count(use_case, calls=1, errors=1, latency_s=time.monotonic() - started)
+                raise
+        self._done(use_case, model, started, response.prompt_tokens, response.output_tokens)
+        return response.text
+
+    # ── cache store ──
+    def _cached(self, key, use_case):
+        try:
+            hit = self.store.get(key)
+        except Exception as e:
+            logger.warning("llm cache read failed: %s", e)
+            return None
+        if hit is not None:
+            self._count(use_case, cache_hits=1)
+        return hit
+
+    def _remember(self, key, text, ttl):
+        try:
+            self.store.set(key, text, ttl)
+        except Exception as e:
+            logger.warning("llm cache write failed: %s", e)
+
+    # ── public ──
+    def generate(self, prompt, use_case='default', model=DEFAULT_MODEL, user=None, config=None,
+                 cache=True, ttl=None, refresh=False):
+        """
+        prompt: ข้อความที่ส่งให้โมเดล ; use_case: ชื่อกลุ่มการใช้งาน (อายุ cache + metrics)
+        user: User หรือ user id — จำกัดจำนวนการเรียกพร้อมกันต่อคน ; cache=False: ไม่ cache / ไม่ coalesce
+        refresh=True: ไม่อ่านคำตอบเดิมจาก cache (ผู้ใช้กดวิเคราะห์ใหม่) แต่เก็บคำตอบใหม่แทน
+        Returns: ข้อความคำตอบ ('' ถ้าโมเดลไม่ตอบ)
+        """
+        user_id = getattr(user, 'pk', user)
+        key = self.cache_key(model, prompt, config) if cache else None
+        if key is None:
+            return self._call(use_case, model, prompt, config, user_id)
+
+        ttl = self.ttls.get(use_case, 0) if ttl is None else ttl
+        if ttl and self.store is not None and not refresh:
+            hit = self._cached(key, use_case)
+            if hit is not None:
+                return hit
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(self.queue_timeout + 300):
+                raise LLMBusyError('รอคำตอบ AI นานเกินไป')
+            self._count(use_case, coalesced=1)
+            if flight.error is not None:
+                raise flight.error
+            return flight.text
+
+        try:
+            flight.text = self._call(use_case, model, prompt, config, user_id)
+            if ttl and self.store is not None and flight.text:
+                self._remember(key, flight.text, ttl)
+            return flight.text
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stream(self, prompt, use_case='default', model=DEFAULT_MODEL, user=None, config=None,
+               cache=True, ttl=None, refresh=False):
+        """
+        เหมือน generate แต่ yield ข้อความทีละส่วนตามที่โมเดลตอบ (cache hit = ส่วนเดียวทั้งคำตอบ)
+        ไม่ coalesce — ผู้ชมแต่ละคนต้องเห็นข้อความไหลของตัวเอง ; คำตอบที่ครบแล้วเก็บลง cache เดียวกับ generate
+        ปิด generator กลางทาง (ผู้ใช้ปิดหน้า) = คืนที่ในคิวทันทีและไม่เก็บคำตอบที่ไม่ครบ
+        """
+        user_id = getattr(user, 'pk', user)
+        key = self.cache_key(model, prompt, config) if cache else None
+        ttl = self.ttls.get(use_case, 0) if ttl is None else ttl
+        use_store = key is not None and ttl and self.store is not None
+        if use_store and not refresh:
+            hit = self._cached(key, use_case)
+            if hit is not None:
+                yield hit
+                return
+
+        parts = []
+        prompt_tokens = output_tokens = 0
+        with self._slot(user_id):
+            started = time.monotonic()
+            try:
+                for piece in self.backend.stream(model, prompt, config):
+                    prompt_tokens = piece.prompt_tokens or prompt_tokens
+                    output_tokens = piece.output_tokens or output_tokens
+                    if piece.text:
+                        parts.append(piece.text)
+                        yield piece.text
+            except GeneratorExit:
+                self._count(use_case, calls=1, latency_s=time.monotonic() - started)
+                raise
+            except Exception:
+                self._count(use_case, calls=1, errors=1, latency_s=time.monotonic() - started)
+                raise
+        self._done(use_case, model, started, prompt_tokens, output_tokens)
+        if use_store and parts:
+            self._remember(key, ''.join(parts), ttl)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def _store_from_settings():
+    store = getattr(settings, 'LLM_CACHE_STORE', 'cache')
+    if store == 'analysis_cache':
+        return AnalysisCacheStore()
+    if store in ('', 'none'):
+        return None
+    return DjangoCacheStore()
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                backend = FakeBackend() if getattr(settings, 'LLM_BACKEND', 'gemini') == 'fake' else GeminiBackend()
+                _gateway = LLMGateway(
+                    backend,
+                    store=_store_from_settings(),
+                    max_concurrency=getattr(settings, 'LLM_MAX_CONCURRENCY', 8),
+                    max_per_user=getattr(settings, 'LLM_MAX_CONCURRENCY_PER_USER', 2),
+                    queue_timeout=getattr(settings, 'LLM_QUEUE_TIMEOUT', 90),
+                    ttls=getattr(settings, 'LLM_CACHE_TTLS', None),
+                )
+    return _gateway
+
+
+def set_gateway(gateway):
+    """แทน gateway ของ process (ใช้ใน test) — Returns: gateway เดิม"""
+    global _gateway
+    previous, _gateway = _gateway, gateway
+    return previous
+
+
+def generate(prompt, use_case='default', model=DEFAULT_MODEL, user=None, config=None, cache=True, ttl=None,
+             refresh=False):
+    return get_gateway().generate(prompt, use_case=use_case, model=model, user=user, config=config,
+                                  cache=cache, ttl=ttl, refresh=refresh)
+
+
+def stream(prompt, use_case='default', model=DEFAULT_MODEL, user=None, config=None, cache=True, ttl=None,
+           refresh=False):
+    return get_gateway().stream(prompt, use_case=use_case, model=model, user=user, config=config,
+                                cache=cache, ttl=ttl, refresh=refresh)
+
+
+def metrics_snapshot():
+    return get_gateway().metrics_snapshot()
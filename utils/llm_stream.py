@@ -0,0 +1,110 @@
+"""
+# ====== LLM Stream — ส่งผลวิเคราะห์ AI แบบ Server-Sent Events ======
+เดิม view วิเคราะห์ AI ยาวๆ (กราฟหุ้น / AI Advisor / Exit Plan / สรุปงานช่าง) รอคำตอบ Gemini ครบก่อนตอบกลับ
+— ค้าง worker ไว้ 10–60 วินาทีต่อคำขอ และผู้ใช้เห็นแค่ spinner จนกว่าทั้งหมดจะเสร็จ
+
+โมดูลนี้:
+- sse_response(producer): StreamingHttpResponse (text/event-stream) ที่ Daphne ส่งต่อได้ทันทีทีละ event
+  producer = ฟังก์ชัน sync ที่ yield (event, data) — รันใน thread แยกหนึ่งตัวต่อ stream (ใช้ ORM / yfinance ได้ตามปกติ)
+  event loop แค่ส่งต่อข้อความจากคิว จึงไม่ค้าง worker ระหว่างรอโมเดล
+  ไบต์แรก (comment ': open') ส่งทันทีก่อนเริ่มเตรียมข้อมูล / ส่ง keep-alive ทุก HEARTBEAT วินาทีระหว่างรอ
+- stream_llm(...): ขั้นตอนมาตรฐานของ producer — ส่ง 'chunk' ทุกส่วนที่โมเดลตอบ (ผ่าน llm_gateway.stream)
+  แล้วบันทึกข้อความเต็ม (persist) และส่ง 'done' พร้อมข้อความสุดท้าย
+- event ที่ client ได้รับ: status {message} / chunk {text} / done {text, ...} / error {error}
+  (client อ่านด้วย fetch + ReadableStream — static/js/sse_stream.js — เพราะบาง endpoint เป็น POST ซึ่ง EventSource ทำไม่ได้)
+"""
+import asyncio
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = 15  # วินาที
+
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n'
+
+
+def _run_producer(producer, put, cancelled):
+    """รันใน thread ของ stream — ปิด generator เสมอ (คืนที่ในคิว LLM) และปิด DB connection ของ thread นี้"""
+    from django.db import connections
+
+    events = None
+    try:
+        events = producer()
+        for event, data in events:
+            if cancelled.is_set():
+                break
+            put(sse_event(event, data))
+    except Exception as e:
+        logger.exception("sse producer failed")
+        put(sse_event('error', {'error': str(e)}))
+    finally:
+        close = getattr(events, 'close', None)
+        if close is not None:
+            close()
+        connections.close_all()
+        put(None)
+
+
+async def _relay(producer):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # event loop ปิดไปแล้ว (client หลุด)
+            cancelled.set()
+
+    yield ': open\n\n'
+    threading.Thread(target=_run_producer, args=(producer, put, cancelled), daemon=True,
+                     name='sse-producer').start()
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if item is None:
+                break
+            yield item
+    finally:
+        cancelled.set()
+
+
+def sse_response(producer):
+    """producer: callable() → iterable ของ (event, data)"""
+    from django.http import StreamingHttpResponse
+
+    response = StreamingHttpResponse(_relay(producer), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: ห้าม buffer
+    return response
+
+
+def stream_llm(prompt, use_case, model, user=None, refresh=False, clean=None, persist=None, extra=None):
+    """
+    yield ('chunk', {'text'}) ตามที่โมเดลตอบ แล้ว ('done', {'text', **extra})
+    clean: ปรับข้อความเต็มก่อนบันทึก / ส่งใน done (client แทนที่ข้อความที่สะสมมาด้วยค่านี้)
+    persist: callable(text) — เรียกเมื่อได้คำตอบครบและไม่ว่าง
+    """
+    from utils.llm_gateway import stream
+
+    parts = []
+    for text in stream(prompt, use_case=use_case, model=model, user=user, refresh=refresh):
+        parts.append(text)
+        yield 'chunk', {'text': text}
+    text = ''.join(parts)
+    if clean is not None:
+        text = clean(text)
+    if not text:
+        yield 'error', {'error': 'AI ไม่ตอบกลับ'}
+        return
+    if persist is not None:
+        persist(text)
+    yield 'done', dict(extra or {}, text=text)